@@ -0,0 +1,87 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 008: Retry queue scheduler
+-- next_retry_at (backoff exponencial + jitter), lease para claims en lote
+-- y cierre de resultados en un solo statement
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Columnas de scheduling y lease ═══
+ALTER TABLE retry_queue ADD COLUMN IF NOT EXISTS next_retry_at TIMESTAMPTZ DEFAULT NOW();
+ALTER TABLE retry_queue ADD COLUMN IF NOT EXISTS locked_until TIMESTAMPTZ;
+ALTER TABLE retry_queue ADD COLUMN IF NOT EXISTS locked_by TEXT;
+
+UPDATE retry_queue SET next_retry_at = COALESCE(last_attempt_at, created_at, NOW())
+WHERE next_retry_at IS NULL;
+
+-- El worker pide "pendientes cuya hora ya llegó" ordenados por next_retry_at
+CREATE INDEX IF NOT EXISTS idx_rq_next_retry ON retry_queue(next_retry_at) WHERE status = 'pending';
+
+-- ═══ 2. claim_retry_queue — toma hasta p_limit filas vencidas con lease ═══
+-- FOR UPDATE SKIP LOCKED + locked_until: dos workers concurrentes nunca
+-- reciben la misma fila; si un worker muere, la fila vuelve al vencer el lease.
+CREATE OR REPLACE FUNCTION claim_retry_queue(
+  p_worker TEXT,
+  p_limit INTEGER DEFAULT 50,
+  p_lease_seconds INTEGER DEFAULT 180
+)
+RETURNS SETOF retry_queue
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  RETURN QUERY
+  UPDATE retry_queue q
+  SET locked_until = NOW() + make_interval(secs => p_lease_seconds),
+      locked_by = p_worker
+  WHERE q.id IN (
+    SELECT id FROM retry_queue
+    WHERE status = 'pending'
+      AND attempts < max_attempts
+      AND next_retry_at <= NOW()
+      AND (locked_until IS NULL OR locked_until < NOW())
+    ORDER BY next_retry_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING q.*;
+END;
+$$;
+
+-- ═══ 3. complete_retry_queue — aplica todos los resultados en un UPDATE ═══
+-- p_results: [{ id, status, attempts, last_error, next_retry_at }]
+-- Solo toca filas que este worker todavía tiene en lease.
+CREATE OR REPLACE FUNCTION complete_retry_queue(
+  p_worker TEXT,
+  p_results JSONB
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_count INTEGER;
+BEGIN
+  UPDATE retry_queue q
+  SET status = r.status,
+      attempts = r.attempts,
+      last_error = COALESCE(r.last_error, q.last_error),
+      next_retry_at = COALESCE(r.next_retry_at, q.next_retry_at),
+      last_attempt_at = CASE WHEN r.attempts > q.attempts THEN NOW() ELSE q.last_attempt_at END,
+      resolved_at = CASE WHEN r.status <> 'pending' THEN NOW() ELSE NULL END,
+      locked_until = NULL,
+      locked_by = NULL
+  FROM jsonb_to_recordset(p_results) AS r(
+    id UUID,
+    status TEXT,
+    attempts INTEGER,
+    last_error TEXT,
+    next_retry_at TIMESTAMPTZ
+  )
+  WHERE q.id = r.id
+    AND q.locked_by = p_worker;
+
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$;
@@ -0,0 +1,11 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 009: Message queue drainer
+-- El drainer toma mensajes 'queued' por prioridad y luego por next_retry_at
+-- ═══════════════════════════════════════════════════════════════════════════
+
+CREATE INDEX IF NOT EXISTS idx_mq_drain
+  ON message_queue(status, priority, next_retry_at);
+
+-- Filas 'queued' previas sin next_retry_at quedan listas para el drainer
+UPDATE message_queue SET next_retry_at = created_at
+  WHERE status = 'queued' AND next_retry_at IS NULL;
@@ -0,0 +1,306 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 010: daily_metrics rollup
+-- Conteos y revenue por día × vendedor × desarrollo × fuente, mantenidos
+-- incrementalmente por triggers en leads y appointments.
+-- Los reportes (diario/semanal/mensual) suman rangos de esta tabla en vez
+-- de escanear filas completas de leads/appointments.
+-- Días en UTC (mismo corte que usan los reportes con toISOString()).
+-- Al final se reconstruye toda la historia de cada tenant (con leads y
+-- appointments bloqueados para escritura) y se marca en
+-- daily_metrics_backfill: sin esa marca los reportes siguen leyendo filas
+-- crudas, y los triggers nunca restan contribuciones que no se sumaron.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Tabla ═══
+CREATE TABLE IF NOT EXISTS daily_metrics (
+  tenant_id UUID NOT NULL REFERENCES tenants(id),
+  day DATE NOT NULL,
+  -- Dimensiones NOT NULL para que el PK funcione como llave de upsert
+  vendedor_id UUID NOT NULL DEFAULT '00000000-0000-0000-0000-000000000000',
+  development TEXT NOT NULL DEFAULT '',
+  source TEXT NOT NULL DEFAULT '',
+  leads_created INTEGER NOT NULL DEFAULT 0,
+  leads_lost INTEGER NOT NULL DEFAULT 0,
+  sales_closed INTEGER NOT NULL DEFAULT 0,
+  revenue NUMERIC NOT NULL DEFAULT 0,
+  first_response_count INTEGER NOT NULL DEFAULT 0,
+  first_response_minutes NUMERIC NOT NULL DEFAULT 0,
+  appointments_total INTEGER NOT NULL DEFAULT 0,
+  appointments_completed INTEGER NOT NULL DEFAULT 0,
+  appointments_no_show INTEGER NOT NULL DEFAULT 0,
+  appointments_cancelled INTEGER NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (tenant_id, day, vendedor_id, development, source)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_metrics_tenant_day ON daily_metrics(tenant_id, day);
+
+ALTER TABLE daily_metrics ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON daily_metrics;
+CREATE POLICY tenant_isolation ON daily_metrics FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+-- Marca de backfill: el rollup del tenant cubre toda su historia desde aquí
+CREATE TABLE IF NOT EXISTS daily_metrics_backfill (
+  tenant_id UUID PRIMARY KEY REFERENCES tenants(id),
+  backfilled_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+ALTER TABLE daily_metrics_backfill ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON daily_metrics_backfill;
+CREATE POLICY tenant_isolation ON daily_metrics_backfill FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+-- ═══ 2. Aplicar un delta (upsert aditivo) ═══
+CREATE OR REPLACE FUNCTION daily_metrics_apply(
+  p_tenant UUID, p_day DATE, p_vendedor UUID, p_development TEXT, p_source TEXT,
+  p_leads INTEGER, p_lost INTEGER, p_sales INTEGER, p_revenue NUMERIC,
+  p_resp_count INTEGER, p_resp_minutes NUMERIC,
+  p_appts INTEGER, p_completed INTEGER, p_no_show INTEGER, p_cancelled INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF p_day IS NULL THEN RETURN; END IF;
+  INSERT INTO daily_metrics AS dm (
+    tenant_id, day, vendedor_id, development, source,
+    leads_created, leads_lost, sales_closed, revenue,
+    first_response_count, first_response_minutes,
+    appointments_total, appointments_completed, appointments_no_show, appointments_cancelled
+  ) VALUES (
+    p_tenant, p_day,
+    COALESCE(p_vendedor, '00000000-0000-0000-0000-000000000000'),
+    COALESCE(p_development, ''), COALESCE(p_source, ''),
+    p_leads, p_lost, p_sales, p_revenue, p_resp_count, p_resp_minutes,
+    p_appts, p_completed, p_no_show, p_cancelled
+  )
+  ON CONFLICT (tenant_id, day, vendedor_id, development, source) DO UPDATE SET
+    leads_created = dm.leads_created + EXCLUDED.leads_created,
+    leads_lost = dm.leads_lost + EXCLUDED.leads_lost,
+    sales_closed = dm.sales_closed + EXCLUDED.sales_closed,
+    revenue = dm.revenue + EXCLUDED.revenue,
+    first_response_count = dm.first_response_count + EXCLUDED.first_response_count,
+    first_response_minutes = dm.first_response_minutes + EXCLUDED.first_response_minutes,
+    appointments_total = dm.appointments_total + EXCLUDED.appointments_total,
+    appointments_completed = dm.appointments_completed + EXCLUDED.appointments_completed,
+    appointments_no_show = dm.appointments_no_show + EXCLUDED.appointments_no_show,
+    appointments_cancelled = dm.appointments_cancelled + EXCLUDED.appointments_cancelled,
+    updated_at = now();
+END;
+$$;
+
+-- ═══ 3. Contribución de un lead (sign = +1 / -1) ═══
+-- Un UPDATE resta la contribución de OLD y suma la de NEW: cambios de status,
+-- reasignaciones y correcciones de fuente quedan reflejados sin recalcular.
+CREATE OR REPLACE FUNCTION daily_metrics_lead_contrib(l leads, sign INTEGER)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_price NUMERIC;
+  v_resp NUMERIC;
+BEGIN
+  -- Lead creado
+  PERFORM daily_metrics_apply(l.tenant_id, (l.created_at AT TIME ZONE 'UTC')::date,
+    l.assigned_to, l.property_interest, l.source,
+    sign, 0, 0, 0, 0, 0, 0, 0, 0, 0);
+
+  -- Primera respuesta (mismo filtro que los reportes: 0 < min < 24h)
+  IF l.first_response_at IS NOT NULL AND l.created_at IS NOT NULL THEN
+    v_resp := EXTRACT(EPOCH FROM (l.first_response_at - l.created_at)) / 60;
+    IF v_resp > 0 AND v_resp < 1440 THEN
+      PERFORM daily_metrics_apply(l.tenant_id, (l.created_at AT TIME ZONE 'UTC')::date,
+        l.assigned_to, l.property_interest, l.source,
+        0, 0, 0, 0, sign, sign * v_resp, 0, 0, 0, 0);
+    END IF;
+  END IF;
+
+  -- Venta (revenue = precio de la propiedad, 2M por defecto como en los reportes).
+  -- Mismo set que SALE_STATUSES en dailyMetricsService.ts.
+  IF l.status IN ('closed', 'delivered') THEN
+    SELECT price INTO v_price FROM properties WHERE id = l.property_id;
+    PERFORM daily_metrics_apply(l.tenant_id, (COALESCE(l.status_changed_at, l.created_at) AT TIME ZONE 'UTC')::date,
+      l.assigned_to, l.property_interest, l.source,
+      0, 0, sign, sign * COALESCE(v_price, 2000000), 0, 0, 0, 0, 0, 0);
+  ELSIF l.status = 'lost' THEN
+    PERFORM daily_metrics_apply(l.tenant_id, (COALESCE(l.status_changed_at, l.created_at) AT TIME ZONE 'UTC')::date,
+      l.assigned_to, l.property_interest, l.source,
+      0, sign, 0, 0, 0, 0, 0, 0, 0, 0);
+  END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION daily_metrics_leads_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM daily_metrics_lead_contrib(OLD, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM daily_metrics_lead_contrib(NEW, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_daily_metrics_leads ON leads;
+CREATE TRIGGER trg_daily_metrics_leads
+  AFTER INSERT OR DELETE OR UPDATE OF status, status_changed_at, assigned_to, property_interest, source, property_id, first_response_at, created_at
+  ON leads
+  FOR EACH ROW EXECUTE FUNCTION daily_metrics_leads_trigger();
+
+-- ═══ 4. Contribución de una cita ═══
+CREATE OR REPLACE FUNCTION daily_metrics_appointment_contrib(a appointments, sign INTEGER)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_source TEXT;
+BEGIN
+  SELECT source INTO v_source FROM leads WHERE id = a.lead_id;
+  PERFORM daily_metrics_apply(a.tenant_id, a.scheduled_date::date,
+    a.vendedor_id, a.property_name, v_source,
+    0, 0, 0, 0, 0, 0,
+    sign,
+    CASE WHEN a.status = 'completed' THEN sign ELSE 0 END,
+    CASE WHEN a.status IN ('no_show', 'missed') THEN sign ELSE 0 END,
+    CASE WHEN a.status = 'cancelled' THEN sign ELSE 0 END);
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION daily_metrics_appointments_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM daily_metrics_appointment_contrib(OLD, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM daily_metrics_appointment_contrib(NEW, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_daily_metrics_appointments ON appointments;
+CREATE TRIGGER trg_daily_metrics_appointments
+  AFTER INSERT OR DELETE OR UPDATE OF status, scheduled_date, vendedor_id, property_name, lead_id
+  ON appointments
+  FOR EACH ROW EXECUTE FUNCTION daily_metrics_appointments_trigger();
+
+-- ═══ 5. Backfill / reconciliación de un rango ═══
+-- Recalcula desde las filas crudas (ej. tras cambios de precio de propiedades)
+CREATE OR REPLACE FUNCTION rebuild_daily_metrics_for(p_tenant UUID, p_from DATE, p_to DATE)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_tenant UUID := p_tenant;
+  v_rows INTEGER;
+BEGIN
+  DELETE FROM daily_metrics WHERE tenant_id = v_tenant AND day BETWEEN p_from AND p_to;
+
+  INSERT INTO daily_metrics (
+    tenant_id, day, vendedor_id, development, source,
+    leads_created, leads_lost, sales_closed, revenue,
+    first_response_count, first_response_minutes,
+    appointments_total, appointments_completed, appointments_no_show, appointments_cancelled
+  )
+  SELECT v_tenant, f.day,
+    COALESCE(f.vendedor_id, '00000000-0000-0000-0000-000000000000'),
+    COALESCE(f.development, ''), COALESCE(f.source, ''),
+    SUM(f.leads), SUM(f.lost), SUM(f.sales), SUM(f.revenue),
+    SUM(f.resp_count), SUM(f.resp_minutes),
+    SUM(f.appts), SUM(f.completed), SUM(f.no_show), SUM(f.cancelled)
+  FROM (
+    -- Leads creados + primera respuesta
+    SELECT (l.created_at AT TIME ZONE 'UTC')::date AS day, l.assigned_to AS vendedor_id,
+      l.property_interest AS development, l.source,
+      1 AS leads, 0 AS lost, 0 AS sales, 0::numeric AS revenue,
+      CASE WHEN r.m > 0 AND r.m < 1440 THEN 1 ELSE 0 END AS resp_count,
+      CASE WHEN r.m > 0 AND r.m < 1440 THEN r.m ELSE 0 END AS resp_minutes,
+      0 AS appts, 0 AS completed, 0 AS no_show, 0 AS cancelled
+    FROM leads l
+    CROSS JOIN LATERAL (SELECT EXTRACT(EPOCH FROM (l.first_response_at - l.created_at)) / 60 AS m) r
+    WHERE l.tenant_id = v_tenant
+      AND (l.created_at AT TIME ZONE 'UTC')::date BETWEEN p_from AND p_to
+    UNION ALL
+    -- Ventas y perdidos
+    SELECT (COALESCE(l.status_changed_at, l.created_at) AT TIME ZONE 'UTC')::date, l.assigned_to,
+      l.property_interest, l.source,
+      0,
+      CASE WHEN l.status = 'lost' THEN 1 ELSE 0 END,
+      CASE WHEN l.status <> 'lost' THEN 1 ELSE 0 END,
+      CASE WHEN l.status <> 'lost' THEN COALESCE(p.price, 2000000) ELSE 0 END,
+      0, 0, 0, 0, 0, 0
+    FROM leads l
+    LEFT JOIN properties p ON p.id = l.property_id
+    WHERE l.tenant_id = v_tenant
+      AND l.status IN ('closed', 'delivered', 'lost') -- SALE_STATUSES + lost
+      AND (COALESCE(l.status_changed_at, l.created_at) AT TIME ZONE 'UTC')::date BETWEEN p_from AND p_to
+    UNION ALL
+    -- Citas
+    SELECT a.scheduled_date::date, a.vendedor_id, a.property_name, ld.source,
+      0, 0, 0, 0, 0, 0,
+      1,
+      CASE WHEN a.status = 'completed' THEN 1 ELSE 0 END,
+      CASE WHEN a.status IN ('no_show', 'missed') THEN 1 ELSE 0 END,
+      CASE WHEN a.status = 'cancelled' THEN 1 ELSE 0 END
+    FROM appointments a
+    LEFT JOIN leads ld ON ld.id = a.lead_id
+    WHERE a.tenant_id = v_tenant
+      AND a.scheduled_date::date BETWEEN p_from AND p_to
+  ) f
+  GROUP BY f.day, COALESCE(f.vendedor_id, '00000000-0000-0000-0000-000000000000'),
+    COALESCE(f.development, ''), COALESCE(f.source, '');
+
+  GET DIAGNOSTICS v_rows = ROW_COUNT;
+  RETURN v_rows;
+END;
+$$;
+
+-- Tenant del request (RPC desde el worker)
+CREATE OR REPLACE FUNCTION rebuild_daily_metrics(p_from DATE, p_to DATE)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+  SELECT rebuild_daily_metrics_for(current_tenant_id(), p_from, p_to);
+$$;
+
+-- ═══ 6. Tenants nuevos: sin historia previa, los triggers cubren todo ═══
+CREATE OR REPLACE FUNCTION daily_metrics_tenant_backfilled()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  INSERT INTO daily_metrics_backfill (tenant_id) VALUES (NEW.id)
+  ON CONFLICT (tenant_id) DO NOTHING;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_daily_metrics_tenant_backfilled ON tenants;
+CREATE TRIGGER trg_daily_metrics_tenant_backfilled
+  AFTER INSERT ON tenants
+  FOR EACH ROW EXECUTE FUNCTION daily_metrics_tenant_backfilled();
+
+-- ═══ 7. Backfill de toda la historia ═══
+-- El lock (compatible con lecturas) impide escrituras entre el backfill y el
+-- commit de la migración: ninguna fila queda sin contar ni contada dos veces.
+LOCK TABLE leads, appointments IN SHARE ROW EXCLUSIVE MODE;
+
+DO $$
+DECLARE
+  v_tenant UUID;
+BEGIN
+  FOR v_tenant IN SELECT id FROM tenants LOOP
+    PERFORM rebuild_daily_metrics_for(v_tenant, '1900-01-01', '9999-12-31');
+    INSERT INTO daily_metrics_backfill (tenant_id) VALUES (v_tenant)
+    ON CONFLICT (tenant_id) DO UPDATE SET backfilled_at = now();
+  END LOOP;
+END;
+$$;
@@ -0,0 +1,110 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 011: BI aggregation RPCs + intent counters
+-- GROUP BY en la base para /api/dashboard/kpis, /api/metrics/conversation y
+-- /api/metrics/leads/aggregate: el worker recibe conteos, no filas.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Conteo de leads por dimensión ═══
+CREATE OR REPLACE FUNCTION bi_lead_counts(p_dimension TEXT DEFAULT 'status', p_since TIMESTAMPTZ DEFAULT NULL)
+RETURNS TABLE(key TEXT, count BIGINT)
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+  -- Whitelist: la columna se interpola con %I
+  IF p_dimension NOT IN ('status', 'source', 'property_interest', 'assigned_to') THEN
+    RAISE EXCEPTION 'Dimensión no permitida: %', p_dimension;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'SELECT COALESCE(%I::text, '''') AS key, COUNT(*) AS count
+       FROM leads
+      WHERE tenant_id = current_tenant_id()
+        AND ($1 IS NULL OR created_at >= $1)
+      GROUP BY 1
+      ORDER BY 2 DESC',
+    p_dimension
+  ) USING p_since;
+END;
+$$;
+
+-- ═══ 2. Métricas de conversación (un solo JSON) ═══
+CREATE OR REPLACE FUNCTION bi_conversation_metrics(p_since TIMESTAMPTZ)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH l AS (
+    SELECT status, source, property_interest,
+      CASE WHEN jsonb_typeof(conversation_history) = 'array' THEN conversation_history ELSE '[]'::jsonb END AS h
+    FROM leads
+    WHERE tenant_id = current_tenant_id() AND created_at >= p_since
+  ),
+  totals AS (
+    SELECT COUNT(*) AS total,
+      COUNT(*) FILTER (WHERE jsonb_array_length(h) > 0) AS con_conversacion,
+      COALESCE(SUM(jsonb_array_length(h)), 0) AS total_mensajes
+    FROM l
+  ),
+  roles AS (
+    SELECT COUNT(*) FILTER (WHERE m->>'role' = 'user') AS usuario,
+      COUNT(*) FILTER (WHERE m->>'role' = 'assistant') AS sara
+    FROM l, jsonb_array_elements(l.h) m
+  ),
+  citas AS (
+    SELECT COUNT(*) AS total,
+      COUNT(*) FILTER (WHERE status = 'completed') AS completadas,
+      COUNT(*) FILTER (WHERE status = 'no_show') AS no_show,
+      COUNT(*) FILTER (WHERE status = 'cancelled') AS canceladas
+    FROM appointments
+    WHERE tenant_id = current_tenant_id() AND created_at >= p_since
+  )
+  SELECT jsonb_build_object(
+    'leads_total', totals.total,
+    'con_conversacion', totals.con_conversacion,
+    'total_mensajes', totals.total_mensajes,
+    'mensajes_usuario', roles.usuario,
+    'mensajes_sara', roles.sara,
+    'por_status', (SELECT COALESCE(jsonb_object_agg(k, c), '{}'::jsonb)
+                     FROM (SELECT COALESCE(status, '') AS k, COUNT(*) AS c FROM l GROUP BY 1) s),
+    'por_fuente', (SELECT COALESCE(jsonb_object_agg(k, c), '{}'::jsonb)
+                     FROM (SELECT COALESCE(source, 'desconocido') AS k, COUNT(*) AS c FROM l GROUP BY 1) f),
+    'desarrollos_populares', (SELECT COALESCE(jsonb_agg(jsonb_build_object('nombre', k, 'count', c) ORDER BY c DESC), '[]'::jsonb)
+                     FROM (SELECT property_interest AS k, COUNT(*) AS c FROM l
+                            WHERE property_interest IS NOT NULL AND property_interest <> ''
+                            GROUP BY 1 ORDER BY 2 DESC LIMIT 5) d),
+    'citas', jsonb_build_object(
+      'total', citas.total,
+      'completadas', citas.completadas,
+      'no_show', citas.no_show,
+      'canceladas', citas.canceladas
+    )
+  )
+  FROM totals, roles, citas;
+$$;
+
+-- ═══ 3. Contadores de intención/objeción (escritos al recibir cada mensaje) ═══
+CREATE TABLE IF NOT EXISTS conversation_intent_counts (
+  tenant_id UUID NOT NULL REFERENCES tenants(id),
+  day DATE NOT NULL,
+  kind TEXT NOT NULL,   -- intent | objection
+  label TEXT NOT NULL,
+  count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (tenant_id, day, kind, label)
+);
+
+ALTER TABLE conversation_intent_counts ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON conversation_intent_counts;
+CREATE POLICY tenant_isolation ON conversation_intent_counts FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+CREATE OR REPLACE FUNCTION increment_conversation_intents(p_day DATE, p_items JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+  INSERT INTO conversation_intent_counts AS cic (tenant_id, day, kind, label, count)
+  SELECT current_tenant_id(), p_day, i->>'kind', i->>'label', COALESCE((i->>'count')::int, 1)
+  FROM jsonb_array_elements(p_items) i
+  ON CONFLICT (tenant_id, day, kind, label)
+  DO UPDATE SET count = cic.count + EXCLUDED.count;
+$$;
@@ -0,0 +1,82 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 012: Incremental backups
+-- updated_at confiable en las tablas respaldadas (trigger BEFORE UPDATE) e
+-- índice (tenant_id, updated_at) para leer solo lo que cambió desde la
+-- marca de agua del último manifest.
+-- Los borrados físicos (DELETE de leads con sus citas, /admin/delete-lead)
+-- quedan en backup_tombstones; el delta los exporta como {id, _deleted}
+-- y compactación/restore los aplican.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 0. Tombstones: una fila por registro borrado ═══
+CREATE TABLE IF NOT EXISTS backup_tombstones (
+  table_name TEXT NOT NULL,
+  id TEXT NOT NULL,
+  tenant_id UUID,
+  deleted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (table_name, id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_backup_tombstones_deleted_at ON backup_tombstones(tenant_id, table_name, deleted_at, id);
+
+ALTER TABLE backup_tombstones ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON backup_tombstones;
+CREATE POLICY tenant_isolation ON backup_tombstones FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+-- SECURITY DEFINER: el borrado de un admin no debe fallar por RLS del tombstone
+CREATE OR REPLACE FUNCTION record_backup_tombstone()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO backup_tombstones (table_name, id, tenant_id, deleted_at)
+  VALUES (TG_TABLE_NAME, OLD.id::text, OLD.tenant_id, now())
+  ON CONFLICT (table_name, id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at, tenant_id = EXCLUDED.tenant_id;
+  RETURN NULL;
+END;
+$$;
+
+-- ═══ 1. Trigger genérico: updated_at = now() en cada UPDATE ═══
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.updated_at := now();
+  RETURN NEW;
+END;
+$$;
+
+-- ═══ 2. Columna + triggers + índice en las tablas del backup incremental ═══
+DO $$
+DECLARE
+  tbl TEXT;
+  backup_tables TEXT[] := ARRAY['leads', 'appointments', 'team_members', 'properties', 'followup_rules'];
+BEGIN
+  FOREACH tbl IN ARRAY backup_tables
+  LOOP
+    IF NOT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_schema = 'public' AND table_name = tbl) THEN
+      RAISE NOTICE 'Table % does not exist, skipping', tbl;
+      CONTINUE;
+    END IF;
+
+    EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()', tbl);
+
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_touch_updated_at ON %I', tbl);
+    EXECUTE format(
+      'CREATE TRIGGER trg_touch_updated_at BEFORE UPDATE ON %I FOR EACH ROW EXECUTE FUNCTION touch_updated_at()',
+      tbl
+    );
+
+    EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I (tenant_id, updated_at, id)', 'idx_' || tbl || '_updated_at', tbl);
+
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_backup_tombstone ON %I', tbl);
+    EXECUTE format(
+      'CREATE TRIGGER trg_backup_tombstone AFTER DELETE ON %I FOR EACH ROW EXECUTE FUNCTION record_backup_tombstone()',
+      tbl
+    );
+  END LOOP;
+END $$;
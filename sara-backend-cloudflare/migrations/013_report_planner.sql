@@ -0,0 +1,258 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 013: Report query planner
+-- El worker compila un ReportConfig a un plan JSONB (columnas validadas
+-- contra whitelist) y report_aggregate lo ejecuta como un solo SELECT ...
+-- GROUP BY parametrizado. report_run_snapshot usa report_snapshots como
+-- cache materializado: si el hash del plan y la marca de agua de la entidad
+-- no cambiaron, devuelve el último snapshot sin recalcular.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Snapshots: hash del plan + marca de agua ═══
+ALTER TABLE report_snapshots ADD COLUMN IF NOT EXISTS config_hash TEXT;
+ALTER TABLE report_snapshots ADD COLUMN IF NOT EXISTS watermark TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_report_snapshots_cache
+  ON report_snapshots(report_id, config_hash, generated_at DESC);
+
+-- ═══ 2. Marca de agua de una entidad (max updated_at + conteo) ═══
+CREATE OR REPLACE FUNCTION report_watermark(p_entity TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+  ts_col TEXT := 'created_at';
+  result TEXT;
+BEGIN
+  IF p_entity NOT IN ('leads', 'appointments', 'tasks', 'communications') THEN
+    RAISE EXCEPTION 'Entidad no permitida: %', p_entity;
+  END IF;
+
+  -- updated_at donde existe (migración 012); communications solo tiene created_at
+  IF EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = p_entity AND column_name = 'updated_at'
+  ) THEN
+    ts_col := 'updated_at';
+  END IF;
+
+  -- El conteo detecta borrados, que no mueven max(updated_at)
+  EXECUTE format(
+    'SELECT COALESCE(MAX(%I)::text, '''') || ''|'' || COUNT(*) FROM %I WHERE tenant_id = current_tenant_id()',
+    ts_col, p_entity
+  ) INTO result;
+
+  RETURN result;
+END;
+$$;
+
+-- ═══ 3. Ejecutar un plan: filas agrupadas + totales en una llamada ═══
+-- p_plan = {
+--   entity, dimensions: [col], metrics: [{ fn, field? }],
+--   filters: [{ field, op: 'eq' | 'in' | 'is_null', value }],
+--   date_from?, date_to?, sort?: { key, desc }, limit?, offset?, totals?
+-- }
+-- Identificadores se validan contra el mismo whitelist que el worker
+-- (REPORT_DIMENSIONS / NUMERIC_FIELDS en reportBuilderService.ts, mantener
+-- iguales) y se interpolan con %I; los valores nunca se interpolan: se leen
+-- de $1 (el plan) en el query.
+CREATE OR REPLACE FUNCTION report_aggregate(p_plan JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+  v_entity TEXT := p_plan->>'entity';
+  v_cols TEXT[];
+  v_allowed TEXT[];
+  v_numeric TEXT[];
+  v_dims TEXT[] := '{}';
+  v_dim_list TEXT;
+  v_metrics TEXT[] := '{}';
+  v_aliases TEXT[] := '{}';
+  v_where TEXT := 'tenant_id = current_tenant_id()';
+  v_order TEXT;
+  v_grouped TEXT;
+  v_rows JSONB;
+  v_totals JSONB := '{}'::jsonb;
+  v_fn TEXT;
+  v_field TEXT;
+  v_alias TEXT;
+  item JSONB;
+  i INTEGER := 0;
+BEGIN
+  IF v_entity IS NULL OR v_entity NOT IN ('leads', 'appointments', 'tasks', 'communications') THEN
+    RAISE EXCEPTION 'Entidad no permitida: %', v_entity;
+  END IF;
+
+  -- Whitelists (REPORT_DIMENSIONS / NUMERIC_FIELDS)
+  v_allowed := CASE v_entity
+    WHEN 'leads' THEN ARRAY['status', 'source', 'property_interest', 'assigned_to', 'funnel_status', 'lost_reason', 'preferred_channel']
+    WHEN 'appointments' THEN ARRAY['status', 'vendedor_id', 'property_id', 'scheduled_date']
+    WHEN 'tasks' THEN ARRAY['status', 'priority', 'task_type', 'assigned_to']
+    WHEN 'communications' THEN ARRAY['channel', 'direction', 'status', 'team_member_id']
+  END;
+  v_numeric := CASE v_entity
+    WHEN 'leads' THEN ARRAY['score', 'budget_min', 'budget_max']
+    WHEN 'appointments' THEN ARRAY['duration_minutes']
+    WHEN 'tasks' THEN ARRAY['priority_order']
+    WHEN 'communications' THEN ARRAY['message_count']
+  END;
+
+  -- Columnas reales: un campo numérico del whitelist que la tabla no tiene vale 0
+  SELECT array_agg(column_name::text) INTO v_cols
+  FROM information_schema.columns
+  WHERE table_schema = 'public' AND table_name = v_entity;
+
+  -- Dimensiones
+  FOR v_field IN SELECT jsonb_array_elements_text(COALESCE(p_plan->'dimensions', '[]'::jsonb)) LOOP
+    IF NOT COALESCE(v_field = ANY(v_allowed), false) THEN
+      RAISE EXCEPTION 'Dimensión no permitida: %', v_field;
+    END IF;
+    v_dims := v_dims || v_field;
+  END LOOP;
+
+  SELECT string_agg(format('%I', d), ', ' ORDER BY n) INTO v_dim_list
+  FROM unnest(v_dims) WITH ORDINALITY AS u(d, n);
+
+  -- Métricas (alias fijo fn_campo, igual que el cálculo en el worker)
+  FOR item IN SELECT * FROM jsonb_array_elements(COALESCE(p_plan->'metrics', '[]'::jsonb)) LOOP
+    v_fn := item->>'fn';
+    IF v_fn = 'count' THEN
+      v_metrics := v_metrics || 'COUNT(*) AS count'::text;
+      v_aliases := v_aliases || 'count'::text;
+    ELSIF v_fn IN ('sum', 'avg', 'min', 'max') THEN
+      v_field := item->>'field';
+      v_alias := v_fn || '_' || v_field;
+      IF NOT COALESCE(v_field = ANY(v_numeric), false) THEN
+        RAISE EXCEPTION 'Campo no permitido: %', v_field;
+      ELSIF NOT COALESCE(v_field = ANY(v_cols), false) THEN
+        -- Campo del whitelist que esta tabla no tiene: 0, como en el worker
+        v_metrics := v_metrics || format('0 AS %I', v_alias);
+      ELSIF v_fn = 'avg' THEN
+        v_metrics := v_metrics || format('COALESCE(ROUND(AVG(%I)::numeric, 2), 0) AS %I', v_field, v_alias);
+      ELSE
+        v_metrics := v_metrics || format('COALESCE(%s(%I), 0) AS %I', upper(v_fn), v_field, v_alias);
+      END IF;
+      v_aliases := v_aliases || v_alias;
+    ELSE
+      RAISE EXCEPTION 'Métrica no permitida: %', v_fn;
+    END IF;
+  END LOOP;
+
+  IF array_length(v_metrics, 1) IS NULL THEN
+    v_metrics := ARRAY['COUNT(*) AS count'];
+    v_aliases := ARRAY['count'];
+  END IF;
+
+  -- Filtros: el valor se lee del plan ($1) por posición
+  FOR item IN SELECT * FROM jsonb_array_elements(COALESCE(p_plan->'filters', '[]'::jsonb)) LOOP
+    v_field := item->>'field';
+    IF NOT COALESCE(v_field = ANY(v_allowed), false) THEN
+      RAISE EXCEPTION 'Filtro no permitido: %', v_field;
+    END IF;
+    CASE item->>'op'
+      WHEN 'eq' THEN
+        v_where := v_where || format(' AND %I::text = ($1->''filters''->%s->>''value'')', v_field, i);
+      WHEN 'in' THEN
+        v_where := v_where || format(' AND %I::text IN (SELECT jsonb_array_elements_text($1->''filters''->%s->''value''))', v_field, i);
+      WHEN 'is_null' THEN
+        v_where := v_where || format(' AND %I IS NULL', v_field);
+      ELSE
+        RAISE EXCEPTION 'Operador no permitido: %', item->>'op';
+    END CASE;
+    i := i + 1;
+  END LOOP;
+
+  IF p_plan->>'date_from' IS NOT NULL THEN
+    v_where := v_where || ' AND created_at >= ($1->>''date_from'')::timestamptz';
+  END IF;
+  IF p_plan->>'date_to' IS NOT NULL THEN
+    v_where := v_where || ' AND created_at <= ($1->>''date_to'')::timestamptz';
+  END IF;
+
+  -- Orden: solo por dimensión o alias de métrica; desempate por dimensiones
+  IF p_plan->'sort'->>'key' IS NOT NULL THEN
+    v_alias := p_plan->'sort'->>'key';
+    IF NOT (v_alias = ANY(v_dims) OR v_alias = ANY(v_aliases)) THEN
+      RAISE EXCEPTION 'Orden no permitido: %', v_alias;
+    END IF;
+    v_order := format('%I %s NULLS LAST', v_alias,
+      CASE WHEN COALESCE((p_plan->'sort'->>'desc')::boolean, false) THEN 'DESC' ELSE 'ASC' END);
+  END IF;
+  v_order := COALESCE(NULLIF(concat_ws(', ', v_order, v_dim_list), ''), '1');
+
+  v_grouped := format('SELECT %s FROM %I WHERE %s%s',
+    concat_ws(', ', v_dim_list, array_to_string(v_metrics, ', ')),
+    v_entity,
+    v_where,
+    CASE WHEN v_dim_list IS NULL THEN '' ELSE ' GROUP BY ' || v_dim_list END
+  );
+
+  EXECUTE format(
+    'SELECT COALESCE(jsonb_agg(to_jsonb(p) - ''_ord'' ORDER BY p._ord), ''[]''::jsonb)
+       FROM (
+         SELECT g.*, row_number() OVER (ORDER BY %s) AS _ord
+         FROM (%s) g
+         ORDER BY _ord
+         LIMIT $2 OFFSET $3
+       ) p',
+    v_order, v_grouped
+  ) INTO v_rows
+  USING p_plan, (p_plan->>'limit')::int, COALESCE((p_plan->>'offset')::int, 0);
+
+  -- Totales sobre todo el conjunto filtrado (las páginas de streaming los omiten)
+  IF COALESCE((p_plan->>'totals')::boolean, true) THEN
+    EXECUTE format('SELECT to_jsonb(t) FROM (SELECT %s FROM %I WHERE %s) t',
+      array_to_string(v_metrics, ', '), v_entity, v_where)
+    INTO v_totals
+    USING p_plan;
+  END IF;
+
+  RETURN jsonb_build_object('rows', v_rows, 'totals', v_totals);
+END;
+$$;
+
+-- ═══ 4. Reporte guardado: snapshot como cache materializado ═══
+-- Una llamada por reporte: si el último snapshot con el mismo hash tiene la
+-- misma marca de agua se devuelve tal cual; si no, se agrega y se guarda.
+CREATE OR REPLACE FUNCTION report_run_snapshot(
+  p_report_id UUID,
+  p_plan JSONB,
+  p_config_hash TEXT,
+  p_force BOOLEAN DEFAULT false
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_watermark TEXT := report_watermark(p_plan->>'entity');
+  v_snapshot report_snapshots%ROWTYPE;
+  v_result JSONB;
+  v_now TIMESTAMPTZ := now();
+BEGIN
+  IF NOT p_force THEN
+    SELECT * INTO v_snapshot
+    FROM report_snapshots
+    WHERE report_id = p_report_id AND config_hash = p_config_hash
+    ORDER BY generated_at DESC
+    LIMIT 1;
+
+    IF FOUND AND v_snapshot.watermark = v_watermark THEN
+      RETURN jsonb_build_object('data', v_snapshot.data, 'cached', true, 'watermark', v_watermark, 'snapshot_id', v_snapshot.id);
+    END IF;
+  END IF;
+
+  v_result := report_aggregate(p_plan);
+  v_result := v_result || jsonb_build_object(
+    'row_count', jsonb_array_length(v_result->'rows'),
+    'generated_at', v_now
+  );
+
+  INSERT INTO report_snapshots (report_id, data, row_count, generated_at, config_hash, watermark)
+  VALUES (p_report_id, v_result, jsonb_array_length(v_result->'rows'), v_now, p_config_hash, v_watermark)
+  RETURNING * INTO v_snapshot;
+
+  RETURN jsonb_build_object('data', v_result, 'cached', false, 'watermark', v_watermark, 'snapshot_id', v_snapshot.id);
+END;
+$$;
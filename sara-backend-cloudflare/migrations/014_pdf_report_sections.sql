@@ -0,0 +1,160 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 014: PDF report section aggregates
+-- Cada sección de PDFReportService declara qué agregados necesita; estas
+-- funciones los calculan en la base (GROUP BY) para que el worker reciba
+-- conteos y top-N en vez de todos los leads/citas del periodo.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Budget numérico (mismo criterio que Number(budget) en el worker) ═══
+-- 0 / vacío / no numérico → NULL, para que el llamador aplique su default
+CREATE OR REPLACE FUNCTION pdf_report_budget(p_budget TEXT)
+RETURNS NUMERIC
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE
+    WHEN p_budget ~ '^\s*[0-9]+(\.[0-9]+)?\s*$' THEN NULLIF(trim(p_budget)::numeric, 0)
+  END;
+$$;
+
+-- ═══ 2. Leads del periodo: embudo, ventas, fuentes, desarrollos, vendedores ═══
+CREATE OR REPLACE FUNCTION pdf_report_lead_stats(p_start TIMESTAMPTZ, p_end TIMESTAMPTZ)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH l AS (
+    SELECT
+      name, funnel_status, assigned_to, score, temperature, created_at, updated_at,
+      COALESCE(NULLIF(source, ''), 'Directo') AS source,
+      NULLIF(property_interest, '') AS property_interest,
+      pdf_report_budget(budget::text) AS budget,
+      status IN ('sold', 'reserved') AS is_sale,
+      status IN ('sold', 'reserved', 'delivered') AS is_closed
+    FROM leads
+    WHERE tenant_id = current_tenant_id()
+      AND created_at >= p_start
+      AND created_at <= p_end
+  )
+  SELECT jsonb_build_object(
+    'total', (SELECT COUNT(*) FROM l),
+    'assigned', (SELECT COUNT(*) FROM l WHERE assigned_to IS NOT NULL),
+    'sales', (SELECT COUNT(*) FROM l WHERE is_sale),
+    'by_funnel', COALESCE((
+      SELECT jsonb_object_agg(k, n) FROM (
+        SELECT COALESCE(NULLIF(funnel_status, ''), 'new') AS k, COUNT(*) AS n FROM l GROUP BY 1
+      ) f
+    ), '{}'::jsonb),
+    'closed', (
+      SELECT jsonb_build_object(
+        'count', COUNT(*),
+        'revenue', COALESCE(SUM(budget), 0),
+        'avg_days', COALESCE(ROUND(AVG(FLOOR(EXTRACT(EPOCH FROM (updated_at - created_at)) / 86400))), 0)
+      )
+      FROM l WHERE is_closed
+    ),
+    'sources', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('source', source, 'count', n, 'sold', s) ORDER BY n DESC) FROM (
+        SELECT source, COUNT(*) AS n, COUNT(*) FILTER (WHERE is_sale) AS s FROM l GROUP BY 1
+      ) x
+    ), '[]'::jsonb),
+    'developments', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('development', d, 'count', n, 'sales', s, 'closed', c, 'revenue', r) ORDER BY n DESC) FROM (
+        SELECT COALESCE(property_interest, 'Sin especificar') AS d, COUNT(*) AS n,
+          COUNT(*) FILTER (WHERE is_sale) AS s,
+          COUNT(*) FILTER (WHERE is_closed) AS c,
+          COALESCE(SUM(budget) FILTER (WHERE is_closed), 0) AS r
+        FROM l GROUP BY 1
+      ) x
+    ), '[]'::jsonb),
+    'vendors', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('assigned_to', assigned_to, 'leads', n, 'sales', s, 'closed', c, 'revenue', r)) FROM (
+        SELECT assigned_to, COUNT(*) AS n,
+          COUNT(*) FILTER (WHERE is_sale) AS s,
+          COUNT(*) FILTER (WHERE is_closed) AS c,
+          COALESCE(SUM(budget) FILTER (WHERE is_closed), 0) AS r
+        FROM l WHERE assigned_to IS NOT NULL GROUP BY 1
+      ) x
+    ), '[]'::jsonb),
+    'hot', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+        'name', COALESCE(NULLIF(name, ''), 'Sin nombre'),
+        'score', COALESCE(score, 0),
+        'interest', COALESCE(property_interest, 'No especificado')
+      ) ORDER BY score DESC NULLS LAST) FROM (
+        SELECT * FROM l
+        WHERE temperature = 'HOT' OR score >= 70
+        ORDER BY score DESC NULLS LAST
+        LIMIT 10
+      ) h
+    ), '[]'::jsonb)
+  );
+$$;
+
+-- ═══ 3. Pipeline activo del periodo ═══
+CREATE OR REPLACE FUNCTION pdf_report_pipeline(p_start TIMESTAMPTZ, p_end TIMESTAMPTZ)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH a AS (
+    SELECT
+      name, funnel_status,
+      COALESCE(pdf_report_budget(budget::text), 2500000) AS value,
+      COALESCE(last_activity_at, updated_at) AS last_activity
+    FROM leads
+    WHERE tenant_id = current_tenant_id()
+      AND created_at >= p_start
+      AND created_at <= p_end
+      AND COALESCE(status, '') NOT IN ('sold', 'delivered', 'lost', 'inactive')
+  )
+  SELECT jsonb_build_object(
+    'total_value', COALESCE((SELECT SUM(value) FROM a), 0),
+    'stages', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('stage', funnel_status, 'count', n, 'value', v)) FROM (
+        SELECT funnel_status, COUNT(*) AS n, SUM(value) AS v FROM a WHERE funnel_status IS NOT NULL GROUP BY 1
+      ) s
+    ), '[]'::jsonb),
+    'expected_close_30d', COALESCE((SELECT SUM(value) FROM a WHERE funnel_status IN ('negotiating', 'reserved')), 0),
+    'at_risk', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('name', COALESCE(NULLIF(name, ''), 'Sin nombre'), 'days_stuck', d) ORDER BY d DESC) FROM (
+        SELECT name, FLOOR(EXTRACT(EPOCH FROM (now() - last_activity)) / 86400)::int AS d
+        FROM a
+        WHERE last_activity < now() - interval '7 days'
+        ORDER BY last_activity
+        LIMIT 10
+      ) r
+    ), '[]'::jsonb)
+  );
+$$;
+
+-- ═══ 4. Citas del periodo ═══
+CREATE OR REPLACE FUNCTION pdf_report_appointment_stats(p_from DATE, p_to DATE)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH a AS (
+    SELECT status, vendedor_id, COALESCE(NULLIF(property_name, ''), 'Sin especificar') AS development
+    FROM appointments
+    WHERE tenant_id = current_tenant_id()
+      AND scheduled_date >= p_from
+      AND scheduled_date <= p_to
+  )
+  SELECT jsonb_build_object(
+    'scheduled', (SELECT COUNT(*) FROM a),
+    'completed', (SELECT COUNT(*) FROM a WHERE status = 'completed'),
+    'no_show', (SELECT COUNT(*) FROM a WHERE status = 'no_show'),
+    'developments', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('development', development, 'scheduled', n, 'completed', c) ORDER BY n DESC) FROM (
+        SELECT development, COUNT(*) AS n, COUNT(*) FILTER (WHERE status = 'completed') AS c FROM a GROUP BY 1
+      ) x
+    ), '[]'::jsonb),
+    'vendors', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('vendedor_id', vendedor_id, 'completed', c)) FROM (
+        SELECT vendedor_id, COUNT(*) FILTER (WHERE status = 'completed') AS c
+        FROM a WHERE vendedor_id IS NOT NULL GROUP BY 1
+      ) x
+    ), '[]'::jsonb)
+  );
+$$;
@@ -0,0 +1,425 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 015: Lead stage event log + per-lead value accumulators
+-- Cada cambio de status de un lead (sin importar qué código lo escriba)
+-- deja un evento con el tiempo que pasó en la etapa anterior, y actualiza
+-- incrementalmente lead_value_stats: días por etapa, toques por canal,
+-- canal de adquisición y revenue atribuido. CLV, velocidad del funnel y
+-- atribución leen estos acumuladores en vez de re-escanear leads + notes.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Tablas ═══
+CREATE TABLE IF NOT EXISTS lead_stage_events (
+  id BIGSERIAL PRIMARY KEY,
+  tenant_id UUID NOT NULL REFERENCES tenants(id),
+  lead_id UUID NOT NULL REFERENCES leads(id) ON DELETE CASCADE,
+  from_stage TEXT,
+  to_stage TEXT NOT NULL,
+  changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  days_in_stage NUMERIC NOT NULL DEFAULT 0,
+  assigned_to UUID,
+  triggered_by TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_lead_stage_events_tenant_changed ON lead_stage_events(tenant_id, changed_at);
+CREATE INDEX IF NOT EXISTS idx_lead_stage_events_lead ON lead_stage_events(lead_id, changed_at DESC);
+
+ALTER TABLE lead_stage_events ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON lead_stage_events;
+CREATE POLICY tenant_isolation ON lead_stage_events FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+CREATE TABLE IF NOT EXISTS lead_value_stats (
+  lead_id UUID PRIMARY KEY REFERENCES leads(id) ON DELETE CASCADE,
+  tenant_id UUID NOT NULL REFERENCES tenants(id),
+  stage TEXT,                              -- status actual (sin canonizar)
+  stage_entered_at TIMESTAMPTZ,
+  stage_days JSONB NOT NULL DEFAULT '{}',  -- días acumulados por etapa canónica
+  transitions INTEGER NOT NULL DEFAULT 0,
+  touches JSONB NOT NULL DEFAULT '{}',     -- comunicaciones por canal
+  channel TEXT,                            -- canal de adquisición (classifyChannel)
+  campaign TEXT,
+  assigned_to UUID,
+  referred_by UUID,
+  purchase_value NUMERIC NOT NULL DEFAULT 0,  -- budget (CLV)
+  deal_amount NUMERIC NOT NULL DEFAULT 0,     -- notes.deal_amount (atribución)
+  ad_spend NUMERIC NOT NULL DEFAULT 0,
+  closed_at TIMESTAMPTZ,
+  days_to_close NUMERIC,
+  lead_created_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_lead_value_stats_tenant_created ON lead_value_stats(tenant_id, lead_created_at);
+CREATE INDEX IF NOT EXISTS idx_lead_value_stats_tenant_closed ON lead_value_stats(tenant_id, closed_at);
+CREATE INDEX IF NOT EXISTS idx_lead_value_stats_referred_by ON lead_value_stats(referred_by) WHERE referred_by IS NOT NULL;
+
+ALTER TABLE lead_value_stats ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON lead_value_stats;
+CREATE POLICY tenant_isolation ON lead_value_stats FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+-- ═══ 2. Helpers (mismos criterios que los servicios en el worker) ═══
+CREATE OR REPLACE FUNCTION safe_numeric(p_value TEXT)
+RETURNS NUMERIC
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE WHEN p_value ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$' THEN trim(p_value)::numeric END;
+$$;
+
+-- funnelVelocityService.canonicalStage
+CREATE OR REPLACE FUNCTION funnel_stage(p_status TEXT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE p_status
+    WHEN 'visit_scheduled' THEN 'scheduled'
+    WHEN 'qualified' THEN 'contacted'
+    WHEN 'negotiating' THEN 'negotiation'
+    WHEN 'sold' THEN 'closed'
+    ELSE p_status
+  END;
+$$;
+
+-- revenueAttributionService.classifyChannel
+CREATE OR REPLACE FUNCTION lead_attribution_channel(p_notes JSONB)
+RETURNS TEXT
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+DECLARE
+  v TEXT;
+BEGIN
+  IF jsonb_typeof(p_notes) IS DISTINCT FROM 'object' THEN
+    RETURN 'direct';
+  END IF;
+
+  v := lower(NULLIF(p_notes->>'utm_source', ''));
+  IF v IS NOT NULL THEN
+    RETURN CASE
+      WHEN v LIKE '%facebook%' OR v = 'fb' THEN 'facebook'
+      WHEN v LIKE '%instagram%' OR v = 'ig' THEN 'instagram'
+      WHEN v LIKE '%google%' THEN 'google'
+      WHEN v LIKE '%tiktok%' THEN 'tiktok'
+      WHEN v LIKE '%email%' OR v LIKE '%correo%' THEN 'email'
+      WHEN v LIKE '%referr%' OR v LIKE '%referi%' THEN 'referral'
+      ELSE v
+    END;
+  END IF;
+
+  v := lower(NULLIF(p_notes->>'channel', ''));
+  IF v IS NOT NULL THEN
+    RETURN CASE
+      WHEN v LIKE '%facebook%' OR v = 'fb' THEN 'facebook'
+      WHEN v LIKE '%instagram%' OR v = 'ig' THEN 'instagram'
+      WHEN v LIKE '%google%' THEN 'google'
+      WHEN v LIKE '%referr%' OR v LIKE '%referi%' THEN 'referral'
+      WHEN v LIKE '%organic%' OR v LIKE '%orgánico%' THEN 'organic'
+      ELSE v
+    END;
+  END IF;
+
+  IF NULLIF(p_notes->>'deal_attributed_to', '') IS NOT NULL THEN
+    RETURN p_notes->>'deal_attributed_to';
+  END IF;
+
+  IF NULLIF(p_notes->>'referred_by', '') IS NOT NULL OR NULLIF(p_notes->>'referral_code', '') IS NOT NULL THEN
+    RETURN 'referral';
+  END IF;
+
+  RETURN 'direct';
+END;
+$$;
+
+-- ═══ 3. status_changed_at siempre se escribe al cambiar status ═══
+CREATE OR REPLACE FUNCTION set_status_changed_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.status IS DISTINCT FROM OLD.status
+    AND NEW.status_changed_at IS NOT DISTINCT FROM OLD.status_changed_at THEN
+    NEW.status_changed_at := now();
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_leads_status_changed_at ON leads;
+CREATE TRIGGER trg_leads_status_changed_at
+  BEFORE UPDATE OF status ON leads
+  FOR EACH ROW EXECUTE FUNCTION set_status_changed_at();
+
+-- ═══ 4. Evento de etapa + acumulador por lead ═══
+CREATE OR REPLACE FUNCTION lead_stage_events_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_now TIMESTAMPTZ := now();
+  v_changed BOOLEAN := false;
+  v_from TEXT;
+  v_entered TIMESTAMPTZ;
+  v_days NUMERIC := 0;
+  v_closed BOOLEAN := NEW.status IN ('closed', 'sold', 'delivered', 'reserved');
+  v_since TIMESTAMPTZ := COALESCE(NEW.status_changed_at, NEW.created_at, now());
+BEGIN
+  IF TG_OP = 'UPDATE' AND NEW.status IS DISTINCT FROM OLD.status THEN
+    v_changed := true;
+    v_from := funnel_stage(COALESCE(OLD.status, 'new'));
+    v_since := v_now;
+
+    SELECT stage_entered_at INTO v_entered FROM lead_value_stats WHERE lead_id = NEW.id;
+    v_entered := COALESCE(v_entered, OLD.status_changed_at, OLD.created_at, v_now);
+    v_days := GREATEST(EXTRACT(EPOCH FROM (v_now - v_entered)) / 86400, 0);
+
+    INSERT INTO lead_stage_events (tenant_id, lead_id, from_stage, to_stage, changed_at, days_in_stage, assigned_to)
+    VALUES (NEW.tenant_id, NEW.id, OLD.status, NEW.status, v_now, v_days, NEW.assigned_to);
+  END IF;
+
+  INSERT INTO lead_value_stats AS s (
+    lead_id, tenant_id, stage, stage_entered_at, stage_days, transitions,
+    channel, campaign, assigned_to, referred_by, purchase_value, deal_amount, ad_spend,
+    closed_at, days_to_close, lead_created_at, updated_at
+  ) VALUES (
+    NEW.id, NEW.tenant_id, NEW.status, v_since,
+    CASE WHEN v_changed THEN jsonb_build_object(v_from, v_days) ELSE '{}'::jsonb END,
+    CASE WHEN v_changed THEN 1 ELSE 0 END,
+    lead_attribution_channel(NEW.notes),
+    COALESCE(NULLIF(NEW.notes->>'utm_campaign', ''), NULLIF(NEW.notes->>'campaign', '')),
+    NEW.assigned_to,
+    NEW.referred_by,
+    COALESCE(safe_numeric(NEW.budget::text), 0),
+    COALESCE(safe_numeric(NEW.notes->>'deal_amount'), safe_numeric(NEW.notes->>'budget'), 0),
+    COALESCE(safe_numeric(NEW.notes->>'ad_spend'), 0),
+    CASE WHEN v_closed THEN v_since END,
+    CASE WHEN v_closed THEN GREATEST(EXTRACT(EPOCH FROM (v_since - NEW.created_at)) / 86400, 0) END,
+    NEW.created_at,
+    v_now
+  )
+  ON CONFLICT (lead_id) DO UPDATE SET
+    stage = EXCLUDED.stage,
+    stage_entered_at = CASE WHEN v_changed THEN v_now ELSE COALESCE(s.stage_entered_at, EXCLUDED.stage_entered_at) END,
+    stage_days = CASE WHEN v_changed
+      THEN jsonb_set(s.stage_days, ARRAY[v_from], to_jsonb(COALESCE((s.stage_days->>v_from)::numeric, 0) + v_days))
+      ELSE s.stage_days END,
+    transitions = s.transitions + EXCLUDED.transitions,
+    channel = EXCLUDED.channel,
+    campaign = EXCLUDED.campaign,
+    assigned_to = EXCLUDED.assigned_to,
+    referred_by = EXCLUDED.referred_by,
+    purchase_value = EXCLUDED.purchase_value,
+    deal_amount = EXCLUDED.deal_amount,
+    ad_spend = EXCLUDED.ad_spend,
+    -- Cierre: se fija al entrar a un status cerrado y se limpia si sale
+    closed_at = CASE WHEN v_closed THEN COALESCE(s.closed_at, EXCLUDED.closed_at) END,
+    days_to_close = CASE WHEN v_closed THEN COALESCE(s.days_to_close, EXCLUDED.days_to_close) END,
+    lead_created_at = EXCLUDED.lead_created_at,
+    updated_at = v_now;
+
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_lead_stage_events ON leads;
+CREATE TRIGGER trg_lead_stage_events
+  AFTER INSERT OR UPDATE OF status, notes, budget, assigned_to, referred_by
+  ON leads
+  FOR EACH ROW EXECUTE FUNCTION lead_stage_events_trigger();
+
+-- ═══ 5. Toques por canal (cada comunicación registrada) ═══
+CREATE OR REPLACE FUNCTION lead_touch_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.lead_id IS NOT NULL THEN
+    INSERT INTO lead_value_stats AS s (lead_id, tenant_id, touches)
+    VALUES (NEW.lead_id, NEW.tenant_id, jsonb_build_object(NEW.channel, 1))
+    ON CONFLICT (lead_id) DO UPDATE SET
+      touches = jsonb_set(s.touches, ARRAY[NEW.channel], to_jsonb(COALESCE((s.touches->>NEW.channel)::int, 0) + 1)),
+      updated_at = now();
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_lead_touches ON communications;
+CREATE TRIGGER trg_lead_touches
+  AFTER INSERT ON communications
+  FOR EACH ROW EXECUTE FUNCTION lead_touch_trigger();
+
+-- ═══ 6. Backfill de leads existentes ═══
+INSERT INTO lead_value_stats (
+  lead_id, tenant_id, stage, stage_entered_at, channel, campaign, assigned_to, referred_by,
+  purchase_value, deal_amount, ad_spend, closed_at, days_to_close, lead_created_at, touches
+)
+SELECT
+  l.id, l.tenant_id, l.status, COALESCE(l.status_changed_at, l.created_at),
+  lead_attribution_channel(l.notes),
+  COALESCE(NULLIF(l.notes->>'utm_campaign', ''), NULLIF(l.notes->>'campaign', '')),
+  l.assigned_to, l.referred_by,
+  COALESCE(safe_numeric(l.budget::text), 0),
+  COALESCE(safe_numeric(l.notes->>'deal_amount'), safe_numeric(l.notes->>'budget'), 0),
+  COALESCE(safe_numeric(l.notes->>'ad_spend'), 0),
+  CASE WHEN l.status IN ('closed', 'sold', 'delivered', 'reserved')
+    THEN COALESCE(CASE WHEN l.notes->>'deal_closed_at' ~ '^\d{4}-\d{2}-\d{2}' THEN (l.notes->>'deal_closed_at')::timestamptz END, l.status_changed_at, l.updated_at) END,
+  CASE WHEN l.status IN ('closed', 'sold', 'delivered', 'reserved')
+    THEN GREATEST(EXTRACT(EPOCH FROM (COALESCE(CASE WHEN l.notes->>'deal_closed_at' ~ '^\d{4}-\d{2}-\d{2}' THEN (l.notes->>'deal_closed_at')::timestamptz END, l.status_changed_at, l.updated_at) - l.created_at)) / 86400, 0) END,
+  l.created_at,
+  COALESCE((
+    SELECT jsonb_object_agg(channel, n) FROM (
+      SELECT c.channel, COUNT(*) AS n FROM communications c WHERE c.lead_id = l.id GROUP BY 1
+    ) t
+  ), '{}'::jsonb)
+FROM leads l
+ON CONFLICT (lead_id) DO NOTHING;
+
+-- ═══ 7. Lecturas ═══
+-- Velocidad: tiempos por etapa de los eventos del periodo
+CREATE OR REPLACE FUNCTION funnel_velocity_summary(p_since TIMESTAMPTZ)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH order_ AS (
+    SELECT ARRAY['new', 'contacted', 'scheduled', 'visited', 'negotiation', 'reserved', 'closed', 'delivered'] AS stages
+  ),
+  e AS (
+    SELECT funnel_stage(COALESCE(from_stage, 'new')) AS from_stage, funnel_stage(to_stage) AS to_stage, days_in_stage
+    FROM lead_stage_events
+    WHERE tenant_id = current_tenant_id() AND changed_at >= p_since
+  )
+  SELECT jsonb_build_object(
+    'stages', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+        'stage', from_stage,
+        'avg_days', avg_days,
+        'median_days', median_days,
+        'exits', exits,
+        'advanced', advanced
+      )) FROM (
+        SELECT e.from_stage,
+          AVG(e.days_in_stage) AS avg_days,
+          percentile_cont(0.5) WITHIN GROUP (ORDER BY e.days_in_stage) AS median_days,
+          COUNT(*) AS exits,
+          COUNT(*) FILTER (
+            WHERE COALESCE(array_position(o.stages, e.to_stage), 0) > COALESCE(array_position(o.stages, e.from_stage), 0)
+          ) AS advanced
+        FROM e, order_ o
+        GROUP BY e.from_stage
+      ) x
+    ), '[]'::jsonb),
+    'current', COALESCE((
+      SELECT jsonb_object_agg(stage, n) FROM (
+        SELECT funnel_stage(COALESCE(stage, 'new')) AS stage, COUNT(*) AS n
+        FROM lead_value_stats
+        WHERE tenant_id = current_tenant_id() AND updated_at >= p_since
+        GROUP BY 1
+      ) c
+    ), '{}'::jsonb),
+    'close', COALESCE((
+      SELECT jsonb_build_object('avg_days', AVG(days_to_close), 'count', COUNT(*))
+      FROM lead_value_stats
+      WHERE tenant_id = current_tenant_id() AND closed_at >= p_since
+        AND funnel_stage(stage) IN ('closed', 'delivered')
+    ), '{}'::jsonb),
+    'vendors', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('assigned_to', assigned_to, 'avg_days', avg_days)) FROM (
+        SELECT assigned_to, AVG(days_to_close) AS avg_days
+        FROM lead_value_stats
+        WHERE tenant_id = current_tenant_id() AND closed_at >= p_since
+          AND funnel_stage(stage) IN ('closed', 'delivered') AND assigned_to IS NOT NULL
+        GROUP BY 1
+      ) v
+    ), '[]'::jsonb)
+  );
+$$;
+
+-- Atribución: por canal de los leads creados en el periodo
+CREATE OR REPLACE FUNCTION revenue_attribution_summary(p_since TIMESTAMPTZ)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(jsonb_agg(jsonb_build_object(
+    'channel', channel,
+    'campaigns', campaigns,
+    'leads', leads,
+    'closed', closed,
+    'revenue', revenue,
+    'spend', spend,
+    'avg_days_to_close', avg_days
+  ) ORDER BY revenue DESC), '[]'::jsonb)
+  FROM (
+    SELECT
+      COALESCE(channel, 'direct') AS channel,
+      string_agg(DISTINCT campaign, ', ') AS campaigns,
+      COUNT(*) AS leads,
+      COUNT(*) FILTER (WHERE stage IN ('closed', 'sold', 'delivered', 'reserved')) AS closed,
+      COALESCE(SUM(deal_amount) FILTER (WHERE stage IN ('closed', 'sold', 'delivered', 'reserved')), 0) AS revenue,
+      COALESCE(SUM(ad_spend), 0) AS spend,
+      AVG(days_to_close) FILTER (WHERE stage IN ('closed', 'sold', 'delivered', 'reserved')) AS avg_days
+    FROM lead_value_stats
+    WHERE tenant_id = current_tenant_id() AND lead_created_at >= p_since
+    GROUP BY 1
+  ) a;
+$$;
+
+-- CLV: clientes, referidos y top clientes en una llamada
+CREATE OR REPLACE FUNCTION clv_summary(p_top INTEGER DEFAULT 20)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH customers AS (
+    SELECT s.*
+    FROM lead_value_stats s
+    WHERE s.tenant_id = current_tenant_id() AND s.stage IN ('sold', 'reserved', 'delivered')
+  ),
+  referrals AS (
+    SELECT referred_by, COUNT(*) AS referrals,
+      COUNT(*) FILTER (WHERE stage IN ('sold', 'reserved', 'delivered')) AS conversions,
+      COALESCE(SUM(purchase_value) FILTER (WHERE stage IN ('sold', 'reserved', 'delivered')), 0) AS value
+    FROM lead_value_stats
+    WHERE tenant_id = current_tenant_id() AND referred_by IS NOT NULL
+    GROUP BY 1
+  )
+  SELECT jsonb_build_object(
+    'total_customers', (SELECT COUNT(*) FROM customers),
+    'total_clv', (SELECT COALESCE(SUM(purchase_value), 0) FROM customers),
+    'total_referrals', (SELECT COALESCE(SUM(referrals), 0) FROM referrals),
+    'converted_referrals', (SELECT COALESCE(SUM(conversions), 0) FROM referrals),
+    'referral_revenue', (SELECT COALESCE(SUM(value), 0) FROM referrals),
+    'top_referrers', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+        'name', COALESCE(l.name, 'Desconocido'), 'referrals', r.referrals, 'conversions', r.conversions, 'value_generated', r.value
+      ) ORDER BY r.conversions DESC)
+      FROM (SELECT * FROM referrals ORDER BY conversions DESC LIMIT 5) r
+      LEFT JOIN leads l ON l.id = r.referred_by
+    ), '[]'::jsonb),
+    'customers', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+        'id', x.id, 'name', x.name, 'phone', x.phone, 'email', x.email, 'status', x.status,
+        'updated_at', x.updated_at, 'last_activity_at', x.last_activity_at,
+        'property_interest', x.property_interest, 'budget', x.purchase_value,
+        'nps_score', x.nps_score, 'source', x.source, 'financing_type', x.financing_type,
+        'referred_by_name', rb.name,
+        'referrals_made', COALESCE(r.referrals, 0),
+        'referral_conversions', COALESCE(r.conversions, 0),
+        'referral_value', COALESCE(r.value, 0),
+        'total_interactions', (SELECT COALESCE(SUM(v::int), 0) FROM jsonb_each_text(x.touches) t(k, v))
+      ) ORDER BY x.updated_at DESC)
+      FROM (
+        SELECT l.*, c.purchase_value, c.touches
+        FROM customers c
+        JOIN leads l ON l.id = c.lead_id
+        ORDER BY l.updated_at DESC
+        LIMIT p_top
+      ) x
+      LEFT JOIN referrals r ON r.referred_by = x.id
+      LEFT JOIN leads rb ON rb.id = x.referred_by
+    ), '[]'::jsonb)
+  );
+$$;
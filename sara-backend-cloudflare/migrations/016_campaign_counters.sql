@@ -0,0 +1,387 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 016: Per-campaign rolling counters + source counters
+-- Los comandos de agencia (métricas, ROI, leads por fuente, resumen) leían
+-- marketing_campaigns + todos los leads del periodo en cada consulta. Ahora:
+--   · campaign_counters: enviados/entregados/leídos/respondidos/fallidos,
+--     leads creados y costo por campaña. El worker los incrementa con
+--     escrituras agrupadas desde el envío de broadcasts y el webhook de
+--     estados; leads y costo los mantienen triggers.
+--   · marketing_source_counters: leads del mes por fuente y status, con
+--     revenue de cierres, mantenidos por trigger sobre leads.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. campaign_logs: wamid para atribuir estados de entrega ═══
+ALTER TABLE campaign_logs ADD COLUMN IF NOT EXISTS message_id TEXT;
+ALTER TABLE campaign_logs ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMPTZ;
+ALTER TABLE campaign_logs ADD COLUMN IF NOT EXISTS read_at TIMESTAMPTZ;
+ALTER TABLE campaign_logs ADD COLUMN IF NOT EXISTS replied_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_campaign_logs_message_id ON campaign_logs(message_id) WHERE message_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_campaign_logs_phone_sent ON campaign_logs((right(lead_phone, 10)), sent_at DESC);
+
+-- ═══ 2. Tablas de contadores ═══
+CREATE TABLE IF NOT EXISTS campaign_counters (
+  campaign_id UUID PRIMARY KEY,           -- campaigns.id (broadcast) o marketing_campaigns.id
+  tenant_id UUID NOT NULL REFERENCES tenants(id),
+  sent INTEGER NOT NULL DEFAULT 0,
+  delivered INTEGER NOT NULL DEFAULT 0,
+  read INTEGER NOT NULL DEFAULT 0,
+  replied INTEGER NOT NULL DEFAULT 0,
+  failed INTEGER NOT NULL DEFAULT 0,
+  leads_created INTEGER NOT NULL DEFAULT 0,
+  cost NUMERIC NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_campaign_counters_tenant ON campaign_counters(tenant_id);
+
+ALTER TABLE campaign_counters ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON campaign_counters;
+CREATE POLICY tenant_isolation ON campaign_counters FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+DROP TRIGGER IF EXISTS trg_set_tenant_id ON campaign_counters;
+CREATE TRIGGER trg_set_tenant_id
+  BEFORE INSERT ON campaign_counters
+  FOR EACH ROW EXECUTE FUNCTION set_tenant_id_on_insert();
+
+CREATE TABLE IF NOT EXISTS marketing_source_counters (
+  tenant_id UUID NOT NULL REFERENCES tenants(id),
+  month DATE NOT NULL,                    -- mes de creación del lead
+  source TEXT NOT NULL,                   -- leads.source ('Directo' si vacío)
+  leads INTEGER NOT NULL DEFAULT 0,
+  scheduled INTEGER NOT NULL DEFAULT 0,   -- status = scheduled
+  visited INTEGER NOT NULL DEFAULT 0,     -- status = visited
+  hot INTEGER NOT NULL DEFAULT 0,         -- negotiation / reserved / closed
+  won INTEGER NOT NULL DEFAULT 0,         -- closed / delivered
+  revenue NUMERIC NOT NULL DEFAULT 0,     -- precio de propiedad de los won (al ganar)
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (tenant_id, month, source)
+);
+
+ALTER TABLE marketing_source_counters ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON marketing_source_counters;
+CREATE POLICY tenant_isolation ON marketing_source_counters FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+-- Revenue que cada lead ganado sumó a su bucket: al salir de 'won' se resta
+-- este monto y no el precio actual de la propiedad (que pudo cambiar)
+CREATE TABLE IF NOT EXISTS marketing_source_won (
+  lead_id UUID PRIMARY KEY,
+  tenant_id UUID NOT NULL REFERENCES tenants(id),
+  amount NUMERIC NOT NULL
+);
+
+ALTER TABLE marketing_source_won ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS tenant_isolation ON marketing_source_won;
+CREATE POLICY tenant_isolation ON marketing_source_won FOR ALL
+  USING (tenant_id = current_tenant_id());
+
+-- ═══ 3. Incrementos agrupados desde el worker ═══
+-- p_rows: [{campaign_id, sent, delivered, read, replied, failed, leads_created, cost}]
+CREATE OR REPLACE FUNCTION bump_campaign_counters(p_rows JSONB)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+  WITH d AS (
+    SELECT
+      (r->>'campaign_id')::uuid AS campaign_id,
+      SUM(COALESCE((r->>'sent')::int, 0)) AS sent,
+      SUM(COALESCE((r->>'delivered')::int, 0)) AS delivered,
+      SUM(COALESCE((r->>'read')::int, 0)) AS read,
+      SUM(COALESCE((r->>'replied')::int, 0)) AS replied,
+      SUM(COALESCE((r->>'failed')::int, 0)) AS failed,
+      SUM(COALESCE((r->>'leads_created')::int, 0)) AS leads_created,
+      SUM(COALESCE((r->>'cost')::numeric, 0)) AS cost
+    FROM jsonb_array_elements(p_rows) r
+    WHERE r->>'campaign_id' IS NOT NULL
+    GROUP BY 1
+  ), up AS (
+    INSERT INTO campaign_counters AS c (campaign_id, tenant_id, sent, delivered, read, replied, failed, leads_created, cost)
+    SELECT campaign_id, current_tenant_id(), sent, delivered, read, replied, failed, leads_created, cost FROM d
+    ON CONFLICT (campaign_id) DO UPDATE SET
+      sent = c.sent + EXCLUDED.sent,
+      delivered = c.delivered + EXCLUDED.delivered,
+      read = c.read + EXCLUDED.read,
+      replied = c.replied + EXCLUDED.replied,
+      failed = c.failed + EXCLUDED.failed,
+      leads_created = c.leads_created + EXCLUDED.leads_created,
+      cost = c.cost + EXCLUDED.cost,
+      updated_at = now()
+    RETURNING 1
+  )
+  SELECT COUNT(*)::int FROM up;
+$$;
+
+-- p_statuses: [{message_id, status}] del webhook de Meta
+-- p_phones:   ["521..."] de leads que respondieron
+-- Cada log avanza solo hacia adelante (sent → delivered → read) y cada
+-- transición nueva suma 1 al contador de su campaña; una respuesta cuenta
+-- para el broadcast más reciente (72h) que ese teléfono no había respondido.
+CREATE OR REPLACE FUNCTION record_campaign_events(p_statuses JSONB, p_phones JSONB DEFAULT '[]')
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_rows INTEGER := 0;
+  v_replies INTEGER := 0;
+BEGIN
+  WITH s AS (
+    SELECT DISTINCT ON (r->>'message_id')
+      r->>'message_id' AS message_id,
+      r->>'status' AS status
+    FROM jsonb_array_elements(COALESCE(p_statuses, '[]')) r
+    WHERE r->>'status' IN ('delivered', 'read', 'failed')
+    ORDER BY r->>'message_id', CASE r->>'status' WHEN 'read' THEN 3 WHEN 'delivered' THEN 2 ELSE 1 END DESC
+  ), cur AS (
+    -- Flags calculados sobre la fila previa (RETURNING solo ve la nueva)
+    SELECT l.id, l.campaign_id, s.status,
+      (s.status IN ('delivered', 'read') AND l.delivered_at IS NULL) AS bump_delivered,
+      (s.status = 'read' AND l.read_at IS NULL) AS bump_read,
+      (s.status = 'failed' AND l.status = 'sent') AS bump_failed
+    FROM s
+    JOIN campaign_logs l ON l.message_id = s.message_id
+    WHERE l.tenant_id = current_tenant_id()
+  ), changed AS (
+    UPDATE campaign_logs l SET
+      status = CASE
+        WHEN cur.bump_failed THEN 'failed'
+        WHEN cur.status = 'read' THEN 'read'
+        WHEN cur.status = 'delivered' AND l.read_at IS NULL THEN 'delivered'
+        ELSE l.status END,
+      delivered_at = CASE WHEN cur.bump_delivered THEN now() ELSE l.delivered_at END,
+      read_at = CASE WHEN cur.bump_read THEN now() ELSE l.read_at END
+    FROM cur
+    WHERE l.id = cur.id
+      AND (cur.bump_delivered OR cur.bump_read OR cur.bump_failed)
+    RETURNING cur.campaign_id, cur.bump_delivered, cur.bump_read, cur.bump_failed
+  )
+  SELECT bump_campaign_counters(COALESCE(jsonb_agg(jsonb_build_object(
+    'campaign_id', campaign_id,
+    'delivered', CASE WHEN bump_delivered THEN 1 ELSE 0 END,
+    'read', CASE WHEN bump_read THEN 1 ELSE 0 END,
+    'failed', CASE WHEN bump_failed THEN 1 ELSE 0 END
+  )), '[]'))
+  INTO v_rows
+  FROM changed;
+
+  WITH p AS (
+    SELECT DISTINCT right(value, 10) AS suffix
+    FROM jsonb_array_elements_text(COALESCE(p_phones, '[]'))
+  ), latest AS (
+    SELECT DISTINCT ON (p.suffix) l.id
+    FROM p
+    JOIN campaign_logs l ON right(l.lead_phone, 10) = p.suffix
+    WHERE l.tenant_id = current_tenant_id()
+      AND l.sent_at > now() - interval '72 hours'
+    ORDER BY p.suffix, l.sent_at DESC
+  ), replied AS (
+    UPDATE campaign_logs l SET replied_at = now()
+    FROM latest
+    WHERE l.id = latest.id AND l.replied_at IS NULL
+    RETURNING l.campaign_id
+  )
+  SELECT bump_campaign_counters(COALESCE(jsonb_agg(jsonb_build_object('campaign_id', campaign_id, 'replied', 1)), '[]'))
+  INTO v_replies
+  FROM replied;
+
+  RETURN v_rows + v_replies;
+END;
+$$;
+
+-- ═══ 4. Leads creados y costo por campaña de marketing ═══
+-- Un lead nuevo con utm_campaign/campaign/campaign_id que coincide con una
+-- marketing_campaign (por id o nombre) suma a leads_created.
+CREATE OR REPLACE FUNCTION campaign_lead_created_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_key TEXT := COALESCE(
+    NULLIF(NEW.notes->>'campaign_id', ''),
+    NULLIF(NEW.notes->>'utm_campaign', ''),
+    NULLIF(NEW.notes->>'campaign', '')
+  );
+  v_campaign UUID;
+BEGIN
+  IF v_key IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT id INTO v_campaign
+  FROM marketing_campaigns
+  WHERE tenant_id = NEW.tenant_id
+    AND (id::text = v_key OR lower(name) = lower(v_key))
+  ORDER BY created_at DESC
+  LIMIT 1;
+
+  IF v_campaign IS NOT NULL THEN
+    INSERT INTO campaign_counters AS c (campaign_id, tenant_id, leads_created)
+    VALUES (v_campaign, NEW.tenant_id, 1)
+    ON CONFLICT (campaign_id) DO UPDATE SET
+      leads_created = c.leads_created + 1,
+      updated_at = now();
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_campaign_lead_created ON leads;
+CREATE TRIGGER trg_campaign_lead_created
+  AFTER INSERT ON leads
+  FOR EACH ROW EXECUTE FUNCTION campaign_lead_created_trigger();
+
+-- El gasto lo escribe el CRM / sync de Ads en marketing_campaigns.budget_spent
+CREATE OR REPLACE FUNCTION campaign_cost_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  INSERT INTO campaign_counters AS c (campaign_id, tenant_id, cost)
+  VALUES (NEW.id, NEW.tenant_id, COALESCE(NEW.budget_spent, 0))
+  ON CONFLICT (campaign_id) DO UPDATE SET
+    cost = EXCLUDED.cost,
+    updated_at = now();
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_campaign_cost ON marketing_campaigns;
+CREATE TRIGGER trg_campaign_cost
+  AFTER INSERT OR UPDATE OF budget_spent ON marketing_campaigns
+  FOR EACH ROW EXECUTE FUNCTION campaign_cost_trigger();
+
+-- ═══ 5. Contadores por fuente (mismos buckets que agenciaReportingService) ═══
+CREATE OR REPLACE FUNCTION marketing_source_bump(
+  p_tenant UUID, p_lead_id UUID, p_created TIMESTAMPTZ, p_source TEXT, p_status TEXT, p_property UUID, p_sign INTEGER, p_lead INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_won BOOLEAN := p_status IN ('closed', 'delivered');
+  v_price NUMERIC := 0;
+BEGIN
+  IF v_won AND p_sign < 0 THEN
+    -- Restar exactamente lo que se sumó al ganar
+    DELETE FROM marketing_source_won WHERE lead_id = p_lead_id RETURNING amount INTO v_price;
+    IF v_price IS NULL THEN
+      SELECT price INTO v_price FROM properties WHERE id = p_property;
+      v_price := COALESCE(NULLIF(v_price, 0), 2000000);
+    END IF;
+  ELSIF v_won THEN
+    SELECT price INTO v_price FROM properties WHERE id = p_property;
+    v_price := COALESCE(NULLIF(v_price, 0), 2000000);
+    INSERT INTO marketing_source_won (lead_id, tenant_id, amount)
+    VALUES (p_lead_id, p_tenant, v_price)
+    ON CONFLICT (lead_id) DO UPDATE SET amount = EXCLUDED.amount;
+  END IF;
+
+  INSERT INTO marketing_source_counters AS m (tenant_id, month, source, leads, scheduled, visited, hot, won, revenue)
+  VALUES (
+    p_tenant,
+    date_trunc('month', COALESCE(p_created, now()))::date,
+    COALESCE(NULLIF(p_source, ''), 'Directo'),
+    p_lead,
+    p_sign * (p_status = 'scheduled')::int,
+    p_sign * (p_status = 'visited')::int,
+    p_sign * (p_status IN ('negotiation', 'reserved', 'closed'))::int,
+    p_sign * v_won::int,
+    p_sign * v_price
+  )
+  ON CONFLICT (tenant_id, month, source) DO UPDATE SET
+    leads = m.leads + EXCLUDED.leads,
+    scheduled = m.scheduled + EXCLUDED.scheduled,
+    visited = m.visited + EXCLUDED.visited,
+    hot = m.hot + EXCLUDED.hot,
+    won = m.won + EXCLUDED.won,
+    revenue = m.revenue + EXCLUDED.revenue,
+    updated_at = now();
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION marketing_source_counters_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM marketing_source_bump(NEW.tenant_id, NEW.id, NEW.created_at, NEW.source, NEW.status, NEW.property_id, 1, 1);
+  ELSIF NEW.status IS DISTINCT FROM OLD.status
+    OR NEW.source IS DISTINCT FROM OLD.source
+    OR NEW.property_id IS DISTINCT FROM OLD.property_id THEN
+    -- Sacar al lead de sus buckets anteriores y ponerlo en los nuevos
+    PERFORM marketing_source_bump(OLD.tenant_id, OLD.id, OLD.created_at, OLD.source, OLD.status, OLD.property_id, -1, -1);
+    PERFORM marketing_source_bump(NEW.tenant_id, NEW.id, NEW.created_at, NEW.source, NEW.status, NEW.property_id, 1, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_marketing_source_counters ON leads;
+CREATE TRIGGER trg_marketing_source_counters
+  AFTER INSERT OR UPDATE OF status, source, property_id ON leads
+  FOR EACH ROW EXECUTE FUNCTION marketing_source_counters_trigger();
+
+-- ═══ 6. Backfill ═══
+INSERT INTO marketing_source_won (lead_id, tenant_id, amount)
+SELECT l.id, l.tenant_id, COALESCE(NULLIF(p.price, 0), 2000000)
+FROM leads l
+LEFT JOIN properties p ON p.id = l.property_id
+WHERE l.tenant_id IS NOT NULL AND l.status IN ('closed', 'delivered')
+ON CONFLICT (lead_id) DO NOTHING;
+
+INSERT INTO marketing_source_counters (tenant_id, month, source, leads, scheduled, visited, hot, won, revenue)
+SELECT
+  l.tenant_id,
+  date_trunc('month', l.created_at)::date,
+  COALESCE(NULLIF(l.source, ''), 'Directo'),
+  COUNT(*),
+  COUNT(*) FILTER (WHERE l.status = 'scheduled'),
+  COUNT(*) FILTER (WHERE l.status = 'visited'),
+  COUNT(*) FILTER (WHERE l.status IN ('negotiation', 'reserved', 'closed')),
+  COUNT(*) FILTER (WHERE l.status IN ('closed', 'delivered')),
+  COALESCE(SUM(w.amount) FILTER (WHERE l.status IN ('closed', 'delivered')), 0)
+FROM leads l
+LEFT JOIN marketing_source_won w ON w.lead_id = l.id
+WHERE l.tenant_id IS NOT NULL AND l.created_at IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT (tenant_id, month, source) DO NOTHING;
+
+INSERT INTO campaign_counters (campaign_id, tenant_id, sent, failed)
+SELECT campaign_id, tenant_id,
+  COUNT(*) FILTER (WHERE status <> 'failed'),
+  COUNT(*) FILTER (WHERE status = 'failed')
+FROM campaign_logs
+WHERE campaign_id IS NOT NULL AND tenant_id IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (campaign_id) DO NOTHING;
+
+INSERT INTO campaign_counters (campaign_id, tenant_id, cost)
+SELECT id, tenant_id, COALESCE(budget_spent, 0)
+FROM marketing_campaigns
+WHERE tenant_id IS NOT NULL
+ON CONFLICT (campaign_id) DO UPDATE SET cost = EXCLUDED.cost;
+
+-- ═══ 7. Lecturas para los comandos de agencia ═══
+-- Leads por fuente desde p_since (NULL = histórico completo)
+CREATE OR REPLACE FUNCTION marketing_source_summary(p_since DATE DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(jsonb_agg(jsonb_build_object(
+    'source', source, 'leads', leads, 'scheduled', scheduled, 'visited', visited,
+    'hot', hot, 'won', won, 'revenue', revenue
+  ) ORDER BY leads DESC), '[]'::jsonb)
+  FROM (
+    SELECT source,
+      SUM(leads) AS leads, SUM(scheduled) AS scheduled, SUM(visited) AS visited,
+      SUM(hot) AS hot, SUM(won) AS won, SUM(revenue) AS revenue
+    FROM marketing_source_counters
+    WHERE tenant_id = current_tenant_id()
+      AND (p_since IS NULL OR month >= date_trunc('month', p_since)::date)
+    GROUP BY source
+    HAVING SUM(leads) > 0 OR SUM(won) > 0
+  ) s;
+$$;
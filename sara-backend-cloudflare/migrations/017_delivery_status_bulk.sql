@@ -0,0 +1,48 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 017: Upsert monótono de estados de entrega en bloque
+-- El webhook de estados hacía KV get+put (dedup) y un upsert de
+-- message_delivery_status por cada callback. Ahora el worker junta el batch,
+-- se queda con el estado más avanzado por message_id y llama una vez a
+-- upsert_delivery_statuses. El estado solo avanza (sent < delivered < read,
+-- failed terminal), así que repetidos y atrasados no cambian la fila.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Orden de estados ═══
+CREATE OR REPLACE FUNCTION delivery_status_rank(p_status TEXT)
+RETURNS INTEGER
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE p_status
+    WHEN 'sent' THEN 1
+    WHEN 'delivered' THEN 2
+    WHEN 'read' THEN 3
+    WHEN 'failed' THEN 4
+    ELSE 0
+  END;
+$$;
+
+-- ═══ 2. Upsert multi-row; devuelve solo las filas que avanzaron ═══
+-- p_rows: [{ message_id, recipient_phone, status, timestamp, error_code, error_message }]
+CREATE OR REPLACE FUNCTION upsert_delivery_statuses(p_rows JSONB)
+RETURNS TABLE(message_id TEXT, status TEXT)
+LANGUAGE sql
+AS $$
+  INSERT INTO message_delivery_status AS m
+    (message_id, recipient_phone, status, "timestamp", error_code, error_message, updated_at)
+  SELECT DISTINCT ON (r.message_id)
+    r.message_id, r.recipient_phone, r.status, r."timestamp", r.error_code, r.error_message, now()
+  FROM jsonb_to_recordset(p_rows) AS r(
+    message_id TEXT, recipient_phone TEXT, status TEXT, "timestamp" TIMESTAMPTZ, error_code TEXT, error_message TEXT
+  )
+  WHERE r.message_id IS NOT NULL
+  ORDER BY r.message_id, delivery_status_rank(r.status) DESC
+  ON CONFLICT (message_id) DO UPDATE SET
+    status = EXCLUDED.status,
+    "timestamp" = EXCLUDED."timestamp",
+    error_code = COALESCE(EXCLUDED.error_code, m.error_code),
+    error_message = COALESCE(EXCLUDED.error_message, m.error_message),
+    updated_at = now()
+  WHERE delivery_status_rank(EXCLUDED.status) > delivery_status_rank(m.status)
+  RETURNING m.message_id, m.status;
+$$;
@@ -0,0 +1,38 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 018: Tenant por claim JWT en vez de set_tenant() por request
+-- set_tenant() usa set_config(..., true): el valor solo vive en la
+-- transacción del RPC, y PostgREST abre una transacción por request, así que
+-- las queries siguientes volvían a caer en el default (Santa Rita). Ahora el
+-- worker firma un JWT (role anon + claim tenant_id) con el JWT secret del
+-- proyecto y current_tenant_id() lo lee de request.jwt.claims: PostgREST ya
+-- verificó la firma. No se lee ningún header: X-Tenant-ID lo podría mandar
+-- cualquiera con la anon key y elegir tenant. app.current_tenant sigue
+-- teniendo prioridad para RPCs y scripts que llaman set_tenant() dentro de
+-- su propia transacción.
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. UUID válido o NULL (un header basura no debe romper la query) ═══
+CREATE OR REPLACE FUNCTION try_parse_tenant_uuid(p_value TEXT)
+RETURNS UUID
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE
+    WHEN p_value ~* '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+      THEN p_value::uuid
+    ELSE NULL
+  END;
+$$;
+
+-- ═══ 2. current_tenant_id(): setting → claim JWT firmado → Santa Rita ═══
+CREATE OR REPLACE FUNCTION current_tenant_id()
+RETURNS UUID
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(
+    try_parse_tenant_uuid(NULLIF(current_setting('app.current_tenant', true), '')),
+    try_parse_tenant_uuid(NULLIF(current_setting('request.jwt.claims', true), '')::json->>'tenant_id'),
+    '00000000-0000-0000-0000-000000000001'::uuid  -- Default to Santa Rita
+  );
+$$;
@@ -0,0 +1,39 @@
+-- ═══════════════════════════════════════════════════════════════════════════
+-- MIGRATION 019: Message queue claim con lease
+-- El drainer toma filas con FOR UPDATE SKIP LOCKED + locked_until antes de
+-- enviar: dos invocaciones CRON traslapadas nunca mandan el mismo mensaje
+-- ═══════════════════════════════════════════════════════════════════════════
+
+-- ═══ 1. Columnas de lease ═══
+ALTER TABLE message_queue ADD COLUMN IF NOT EXISTS locked_until TIMESTAMPTZ;
+ALTER TABLE message_queue ADD COLUMN IF NOT EXISTS locked_by TEXT;
+
+-- ═══ 2. claim_message_queue — hasta p_limit filas 'queued' vencidas, por prioridad ═══
+-- Si el worker muere, la fila vuelve a la cola al vencer el lease.
+CREATE OR REPLACE FUNCTION claim_message_queue(
+  p_worker TEXT,
+  p_limit INTEGER DEFAULT 25,
+  p_lease_seconds INTEGER DEFAULT 180
+)
+RETURNS SETOF message_queue
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  RETURN QUERY
+  UPDATE message_queue q
+  SET locked_until = NOW() + make_interval(secs => p_lease_seconds),
+      locked_by = p_worker
+  WHERE q.id IN (
+    SELECT id FROM message_queue
+    WHERE status = 'queued'
+      AND (next_retry_at IS NULL OR next_retry_at <= NOW())
+      AND (locked_until IS NULL OR locked_until < NOW())
+    ORDER BY priority, next_retry_at NULLS FIRST
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING q.*;
+END;
+$$;
@@ -0,0 +1,98 @@
+#!/usr/bin/env node
+// ═══════════════════════════════════════════════════════════════════════════
+// SARA Backend - Cold-start benchmark: bundle de producción vs staging
+// ═══════════════════════════════════════════════════════════════════════════
+// Compara el bundle lean (producción, __DEBUG_ROUTES__ = false) contra el de
+// staging (incluye routes/test.ts y routes/debug.ts, igual que el bundle de
+// producción anterior): tamaño del script y latencia del primer request
+// (import del módulo + fetch('/') en un proceso nuevo, sin I/O de red).
+//
+// Ejecución: node scripts/cold-start-bench.mjs
+// Con opciones: node scripts/cold-start-bench.mjs --runs=20
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { execFileSync, spawnSync } from 'node:child_process';
+import { readdirSync, readFileSync, statSync } from 'node:fs';
+import { gzipSync } from 'node:zlib';
+import { join, resolve } from 'node:path';
+import { pathToFileURL } from 'node:url';
+
+const ROOT = resolve(new URL('..', import.meta.url).pathname);
+const OUT = join(ROOT, '.bench');
+const runs = parseInt(process.argv.find(a => a.startsWith('--runs='))?.split('=')[1] || '10');
+
+const variants = [
+  { name: 'lean (producción)', dir: 'lean', args: [] },
+  { name: 'debug (staging / antes)', dir: 'debug', args: ['--env', 'staging'] },
+];
+
+// ═══════════════════════════════════════════════════════════════════════════
+// BUILD
+// ═══════════════════════════════════════════════════════════════════════════
+
+function build(variant) {
+  const outdir = join(OUT, variant.dir);
+  execFileSync('npx', ['wrangler', 'deploy', '--dry-run', '--outdir', outdir, ...variant.args], {
+    cwd: ROOT,
+    stdio: ['ignore', 'ignore', 'inherit'],
+  });
+  const entry = readdirSync(outdir).find(f => f.endsWith('.js'));
+  if (!entry) throw new Error(`wrangler no generó bundle en ${outdir}`);
+  const file = join(outdir, entry);
+  const code = readFileSync(file);
+  return { file, bytes: statSync(file).size, gzipBytes: gzipSync(code).length };
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// COLD START: un proceso nuevo por corrida (sin caché de módulos)
+// ═══════════════════════════════════════════════════════════════════════════
+
+const PROBE = `
+const t0 = performance.now();
+const mod = await import(process.argv[1]);
+const t1 = performance.now();
+const env = { SUPABASE_URL: 'http://127.0.0.1:9', SUPABASE_ANON_KEY: 'bench' };
+const ctx = { waitUntil() {}, passThroughOnException() {} };
+await mod.default.fetch(new Request('http://localhost/'), env, ctx);
+const t2 = performance.now();
+console.log(JSON.stringify({ importMs: t1 - t0, firstRequestMs: t2 - t0 }));
+`;
+
+function coldStart(file) {
+  const res = spawnSync(process.execPath, ['--input-type=module', '-e', PROBE, pathToFileURL(file).href], {
+    encoding: 'utf8',
+  });
+  const line = res.stdout.trim().split('\n').pop();
+  if (res.status !== 0 || !line) throw new Error(res.stderr || 'probe sin salida');
+  return JSON.parse(line);
+}
+
+function median(values) {
+  const sorted = [...values].sort((a, b) => a - b);
+  return sorted[Math.floor(sorted.length / 2)];
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// MAIN
+// ═══════════════════════════════════════════════════════════════════════════
+
+const results = [];
+for (const variant of variants) {
+  console.log(`🔨 Build ${variant.name}...`);
+  const bundle = build(variant);
+  const samples = Array.from({ length: runs }, () => coldStart(bundle.file));
+  results.push({
+    variant: variant.name,
+    kb: +(bundle.bytes / 1024).toFixed(1),
+    gzipKb: +(bundle.gzipBytes / 1024).toFixed(1),
+    importMs: +median(samples.map(s => s.importMs)).toFixed(1),
+    firstRequestMs: +median(samples.map(s => s.firstRequestMs)).toFixed(1),
+  });
+}
+
+console.log(`\n📊 Cold start (mediana de ${runs} procesos)`);
+console.table(results);
+
+const [lean, debug] = results;
+console.log(`Script: -${(debug.kb - lean.kb).toFixed(1)} KB (${((1 - lean.kb / debug.kb) * 100).toFixed(0)}%)`);
+console.log(`Primer request: -${(debug.firstRequestMs - lean.firstRequestMs).toFixed(1)} ms`);
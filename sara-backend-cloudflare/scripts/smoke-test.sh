@@ -58,7 +58,7 @@ test_endpoint "Health endpoint" "GET" "/health" "200"
 # ═══════════════════════════════════════════════════════════════════════════
 echo -e "\n${YELLOW}[2/4] Auth Tests${NC}"
 test_endpoint "API sin auth (debe rechazar)" "GET" "/api/team-members" "401"
-test_endpoint "Debug sin auth (debe rechazar)" "GET" "/debug-cache" "401"
+test_endpoint "Ops sin auth (debe rechazar)" "GET" "/api/system-status" "401"
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 3. Webhook Tests
@@ -72,7 +72,7 @@ test_endpoint "Webhook rechaza token inválido" "GET" "/webhook/meta?hub.mode=su
 # ═══════════════════════════════════════════════════════════════════════════
 if [ -n "$API_SECRET" ]; then
   echo -e "\n${YELLOW}[4/4] Protected Endpoints (con auth)${NC}"
-  test_endpoint "Debug cache con auth" "GET" "/debug-cache?api_key=$API_SECRET" "200"
+  test_endpoint "System status con auth" "GET" "/api/system-status?api_key=$API_SECRET" "200"
   test_endpoint "API team-members con auth" "GET" "/api/team-members?api_key=$API_SECRET" "200"
 else
   echo -e "\n${YELLOW}[4/4] Protected Endpoints${NC}"
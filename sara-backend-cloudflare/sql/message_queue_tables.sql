@@ -41,6 +41,10 @@ CREATE TABLE IF NOT EXISTS message_queue (
   delivered_at TIMESTAMP WITH TIME ZONE,
   expires_at TIMESTAMP WITH TIME ZONE, -- Calculado según tipo de mensaje
 
+  -- Lease del drainer (claim_message_queue, migración 019)
+  locked_until TIMESTAMP WITH TIME ZONE,
+  locked_by TEXT,
+
   -- Metadatos
   metadata JSONB DEFAULT '{}'
 );
@@ -51,6 +55,7 @@ CREATE INDEX IF NOT EXISTS idx_mq_team_member ON message_queue(team_member_id);
 CREATE INDEX IF NOT EXISTS idx_mq_type ON message_queue(message_type);
 CREATE INDEX IF NOT EXISTS idx_mq_expires ON message_queue(expires_at) WHERE status IN ('queued', 'template_sent');
 CREATE INDEX IF NOT EXISTS idx_mq_retry ON message_queue(next_retry_at) WHERE status = 'queued' AND retry_count < max_retries;
+CREATE INDEX IF NOT EXISTS idx_mq_drain ON message_queue(status, priority, next_retry_at);
 
 -- 2. TABLA DE AUDITORÍA: Tracking completo del ciclo de vida
 CREATE TABLE IF NOT EXISTS message_audit_log (
@@ -12,9 +12,15 @@ CREATE TABLE IF NOT EXISTS retry_queue (
   last_error TEXT,
   last_attempt_at TIMESTAMPTZ,
   status TEXT DEFAULT 'pending',     -- 'pending', 'delivered', 'failed_permanent'
+  next_retry_at TIMESTAMPTZ DEFAULT NOW(), -- Backoff exponencial + jitter (ver migrations/008)
+  locked_until TIMESTAMPTZ,          -- Lease del worker que la reclamó
+  locked_by TEXT,
   created_at TIMESTAMPTZ DEFAULT NOW(),
   resolved_at TIMESTAMPTZ
 );
 
 CREATE INDEX IF NOT EXISTS idx_rq_pending ON retry_queue(status) WHERE status = 'pending';
 CREATE INDEX IF NOT EXISTS idx_rq_created ON retry_queue(created_at);
+CREATE INDEX IF NOT EXISTS idx_rq_next_retry ON retry_queue(next_retry_at) WHERE status = 'pending';
+
+-- RPCs claim_retry_queue / complete_retry_queue: migrations/008_retry_queue_scheduler.sql
@@ -4,8 +4,9 @@
 // ═══════════════════════════════════════════════════════════════════════════
 
 import { SupabaseService } from '../services/supabase';
-import { CacheService } from '../services/cacheService';
+import { CacheService, CACHE_TTLS } from '../services/cacheService';
 import { logErrorToDB } from './healthCheck';
+import { streamRowsToR2, tablesRowStream, createJsonlStream, deleteR2Keys, BackupSource, JsonlCounter, StreamUploadResult } from '../services/backupStreamService';
 
 // ═══════════════════════════════════════════════════════════════════════════
 // TYPES
@@ -276,45 +277,88 @@ export async function getAnalyticsDashboard(
 
     if (!leads) return dashboard;
 
+    // Top sellers: el catálogo se pide antes para acumular en la misma pasada
+    const { data: teamMembers } = await supabase.client
+      .from('team_members')
+      .select('id, name')
+      .eq('active', true);
+
+    const sellerStats: Record<string, { name: string; leads: number; appointments: number; sales: number }> = {};
+    const sellerNames: Record<string, string> = {};
+    (teamMembers || []).forEach((tm: any) => {
+      sellerStats[tm.id] = { name: tm.name, leads: 0, appointments: 0, sales: 0 };
+      sellerNames[tm.id] = tm.name;
+    });
+
+    // Límites de periodo como epoch ms: una sola conversión de fecha por fila
+    const todayMs = todayStart.getTime();
+    const yesterdayMs = yesterdayStart.getTime();
+    const weekMs = weekStart.getTime();
+    const lastWeekMs = lastWeekStart.getTime();
+    const monthMs = monthStart.getTime();
+
+    const sourceCount: Record<string, number> = {};
+    const statusCount: Record<string, number> = {};
+    const wins: Array<{ lead: any; createdMs: number }> = [];
+    let withAppointment = 0;
+    let converted = 0;
+    let responseMinutes = 0;
+    let responseCount = 0;
+
+    // ═══ Una sola pasada sobre los leads ═══
+    for (const l of leads as any[]) {
+      const createdMs = l.created_at ? Date.parse(l.created_at) : NaN;
+      const hasAppointment = l.status === 'cita_agendada' || l.status === 'cita_realizada' || l.status === 'ganado';
+      const isWin = l.status === 'ganado';
+
+      // Funnel
+      if (hasAppointment) withAppointment++;
+      if (isWin) {
+        converted++;
+        wins.push({ lead: l, createdMs });
+      }
+
+      // Periodos (NaN nunca cumple las comparaciones)
+      if (createdMs >= todayMs) dashboard.leads_by_period.today++;
+      if (createdMs >= yesterdayMs && createdMs < todayMs) dashboard.leads_by_period.yesterday++;
+      if (createdMs >= weekMs) dashboard.leads_by_period.this_week++;
+      if (createdMs >= lastWeekMs && createdMs < weekMs) dashboard.leads_by_period.last_week++;
+      if (createdMs >= monthMs) dashboard.leads_by_period.this_month++;
+
+      // Fuente / status
+      const src = l.source || 'WhatsApp';
+      sourceCount[src] = (sourceCount[src] || 0) + 1;
+      const st = l.status || 'nuevo';
+      statusCount[st] = (statusCount[st] || 0) + 1;
+
+      // Vendedores
+      const seller = l.assigned_to ? sellerStats[l.assigned_to] : undefined;
+      if (seller) {
+        seller.leads++;
+        if (hasAppointment) seller.appointments++;
+        if (isWin) seller.sales++;
+      }
+
+      // Tiempo de primera respuesta
+      if (l.first_response_at && l.created_at) {
+        responseMinutes += (Date.parse(l.first_response_at) - createdMs) / 60000;
+        responseCount++;
+      }
+    }
+
     // Funnel metrics
     dashboard.funnel.total_leads = leads.length;
-    dashboard.funnel.leads_with_appointment = leads.filter((l: any) =>
-      l.status === 'cita_agendada' || l.status === 'cita_realizada' || l.status === 'ganado'
-    ).length;
-    dashboard.funnel.leads_converted = leads.filter((l: any) => l.status === 'ganado').length;
+    dashboard.funnel.leads_with_appointment = withAppointment;
+    dashboard.funnel.leads_converted = converted;
 
     if (dashboard.funnel.total_leads > 0) {
       dashboard.funnel.conversion_rate_appointment =
-        ((dashboard.funnel.leads_with_appointment / dashboard.funnel.total_leads) * 100).toFixed(1) + '%';
+        ((withAppointment / dashboard.funnel.total_leads) * 100).toFixed(1) + '%';
       dashboard.funnel.conversion_rate_sale =
-        ((dashboard.funnel.leads_converted / dashboard.funnel.total_leads) * 100).toFixed(1) + '%';
+        ((converted / dashboard.funnel.total_leads) * 100).toFixed(1) + '%';
     }
 
-    // Leads by period
-    dashboard.leads_by_period.today = leads.filter((l: any) =>
-      new Date(l.created_at) >= todayStart
-    ).length;
-    dashboard.leads_by_period.yesterday = leads.filter((l: any) => {
-      const d = new Date(l.created_at);
-      return d >= yesterdayStart && d < todayStart;
-    }).length;
-    dashboard.leads_by_period.this_week = leads.filter((l: any) =>
-      new Date(l.created_at) >= weekStart
-    ).length;
-    dashboard.leads_by_period.last_week = leads.filter((l: any) => {
-      const d = new Date(l.created_at);
-      return d >= lastWeekStart && d < weekStart;
-    }).length;
-    dashboard.leads_by_period.this_month = leads.filter((l: any) =>
-      new Date(l.created_at) >= monthStart
-    ).length;
-
     // Leads by source
-    const sourceCount: Record<string, number> = {};
-    leads.forEach((l: any) => {
-      const src = l.source || 'WhatsApp';
-      sourceCount[src] = (sourceCount[src] || 0) + 1;
-    });
     dashboard.leads_by_source = Object.entries(sourceCount)
       .map(([source, count]) => ({
         source,
@@ -324,11 +368,6 @@ export async function getAnalyticsDashboard(
       .sort((a, b) => b.count - a.count);
 
     // Leads by status
-    const statusCount: Record<string, number> = {};
-    leads.forEach((l: any) => {
-      const st = l.status || 'nuevo';
-      statusCount[st] = (statusCount[st] || 0) + 1;
-    });
     dashboard.leads_by_status = Object.entries(statusCount)
       .map(([status, count]) => ({
         status,
@@ -338,59 +377,26 @@ export async function getAnalyticsDashboard(
       .sort((a, b) => b.count - a.count);
 
     // Top sellers
-    const { data: teamMembers } = await supabase.client
-      .from('team_members')
-      .select('id, name')
-      .eq('active', true);
-
-    if (teamMembers) {
-      const sellerStats: Record<string, { name: string; leads: number; appointments: number; sales: number }> = {};
-
-      teamMembers.forEach((tm: any) => {
-        sellerStats[tm.id] = { name: tm.name, leads: 0, appointments: 0, sales: 0 };
-      });
-
-      leads.forEach((l: any) => {
-        if (l.assigned_to && sellerStats[l.assigned_to]) {
-          sellerStats[l.assigned_to].leads++;
-          if (['cita_agendada', 'cita_realizada', 'ganado'].includes(l.status)) {
-            sellerStats[l.assigned_to].appointments++;
-          }
-          if (l.status === 'ganado') {
-            sellerStats[l.assigned_to].sales++;
-          }
-        }
-      });
-
-      dashboard.top_sellers = Object.values(sellerStats)
-        .filter(s => s.leads > 0)
-        .sort((a, b) => b.sales - a.sales || b.appointments - a.appointments || b.leads - a.leads)
-        .slice(0, 10);
-    }
+    dashboard.top_sellers = Object.values(sellerStats)
+      .filter(s => s.leads > 0)
+      .sort((a, b) => b.sales - a.sales || b.appointments - a.appointments || b.leads - a.leads)
+      .slice(0, 10);
 
     // Response times (simplified)
-    const leadsWithResponse = leads.filter((l: any) => l.first_response_at && l.created_at);
-    if (leadsWithResponse.length > 0) {
-      const totalMinutes = leadsWithResponse.reduce((acc: number, l: any) => {
-        const created = new Date(l.created_at).getTime();
-        const responded = new Date(l.first_response_at).getTime();
-        return acc + (responded - created) / 60000;
-      }, 0);
-      dashboard.response_times.avg_first_response_minutes = Math.round(totalMinutes / leadsWithResponse.length);
+    if (responseCount > 0) {
+      dashboard.response_times.avg_first_response_minutes = Math.round(responseMinutes / responseCount);
     }
 
     // Recent conversions
-    const recentWins = leads
-      .filter((l: any) => l.status === 'ganado')
-      .sort((a: any, b: any) => new Date(b.created_at).getTime() - new Date(a.created_at).getTime())
-      .slice(0, 5);
-
-    dashboard.recent_conversions = recentWins.map((l: any) => ({
-      lead_name: l.name || 'Sin nombre',
-      property: l.property_interest || 'No especificada',
-      date: l.created_at,
-      seller: teamMembers?.find((tm: any) => tm.id === l.assigned_to)?.name || 'No asignado'
-    }));
+    dashboard.recent_conversions = wins
+      .sort((a, b) => b.createdMs - a.createdMs)
+      .slice(0, 5)
+      .map(({ lead: l }) => ({
+        lead_name: l.name || 'Sin nombre',
+        property: l.property_interest || 'No especificada',
+        date: l.created_at,
+        seller: sellerNames[l.assigned_to] || 'No asignado'
+      }));
 
   } catch (e) {
     console.error('Error generating analytics:', e);
@@ -400,6 +406,27 @@ export async function getAnalyticsDashboard(
   return dashboard;
 }
 
+/**
+ * Analytics servido desde CacheService con stale-while-revalidate: cada carga
+ * del CRM responde desde cache y, si está vencido, recalcula en background.
+ * Key por tenant + periodo.
+ */
+export function getCachedAnalyticsDashboard(
+  supabase: SupabaseService,
+  cache: CacheService,
+  periodDays: number
+): Promise<AnalyticsDashboard> {
+  return cache.getOrFetch(
+    `analytics:${supabase.getTenantId()}:${periodDays}`,
+    () => getAnalyticsDashboard(supabase, periodDays),
+    {
+      ttl: CACHE_TTLS.analytics_dashboard,
+      staleWhileRevalidate: CACHE_TTLS.analytics_dashboard_swr,
+      tags: ['analytics', 'leads']
+    }
+  );
+}
+
 // ═══════════════════════════════════════════════════════════════════════════
 // RENDER FUNCTIONS - HTML page generation
 // ═══════════════════════════════════════════════════════════════════════════
@@ -1004,68 +1031,90 @@ export async function exportBackup(supabase: SupabaseService): Promise<any> {
   return backup;
 }
 
+/** Tablas del backup con sus filtros, leídas por páginas */
+export function backupSources(supabase: SupabaseService): BackupSource[] {
+  const hace90dias = new Date();
+  hace90dias.setDate(hace90dias.getDate() - 90);
+  const since = hace90dias.toISOString();
+  const page = (table: string, recentOnly: boolean) => (from: number, to: number) => {
+    let query = supabase.client.from(table).select('*');
+    if (recentOnly) query = query.gte('created_at', since);
+    return query.order('id', { ascending: true }).range(from, to);
+  };
+  return [
+    { table: 'leads', fetchPage: page('leads', true) },
+    { table: 'appointments', fetchPage: page('appointments', true) },
+    { table: 'team_members', fetchPage: page('team_members', false) },
+    { table: 'followup_rules', fetchPage: page('followup_rules', false) },
+    { table: 'properties', fetchPage: page('properties', false) }
+  ];
+}
+
+/**
+ * Mismo contenido que exportBackup, como stream JSONL ({ table, row } por línea)
+ * para responder /backup sin armar el objeto completo en memoria.
+ */
+export function streamBackup(
+  supabase: SupabaseService,
+  options: { gzip?: boolean } = {}
+): { stream: ReadableStream<Uint8Array>; counter: JsonlCounter } {
+  const counter: JsonlCounter = { rows: 0, bytes: 0 };
+  const stream = createJsonlStream(tablesRowStream(backupSources(supabase)), counter, options);
+  return { stream, counter };
+}
+
 // ═══════════════════════════════════════════════════════════════════════════
 // R2 BACKUP SEMANAL - Exporta conversations y leads a R2 como JSONL
+// Streaming paginado → (gzip) → multipart upload; memoria constante
 // ═══════════════════════════════════════════════════════════════════════════
 
 export async function backupSemanalR2(
   supabase: SupabaseService,
-  r2: R2Bucket
-): Promise<{ conversations: { key: string; rows: number; bytes: number }; leads: { key: string; rows: number; bytes: number } }> {
+  r2: R2Bucket,
+  options: { gzip?: boolean } = {}
+): Promise<{ conversations: StreamUploadResult; leads: StreamUploadResult }> {
   const fecha = new Date().toISOString().split('T')[0]; // YYYY-MM-DD
   const hace7dias = new Date();
   hace7dias.setDate(hace7dias.getDate() - 7);
+  const ext = options.gzip ? 'jsonl.gz' : 'jsonl';
 
-  // 1. Export conversation_history de la última semana
-  const { data: convLeads } = await supabase.client
-    .from('leads')
-    .select('id, phone, name, conversation_history, last_message_at')
-    .gte('last_message_at', hace7dias.toISOString())
-    .not('conversation_history', 'is', null);
-
-  let convJsonl = '';
-  let convRows = 0;
-  if (convLeads && convLeads.length > 0) {
-    for (const lead of convLeads) {
-      convJsonl += JSON.stringify({
+  // 1. Export conversation_history de la última semana (paginado, en streaming)
+  const conversations = await streamRowsToR2(r2, `backups/conversations/${fecha}.${ext}`, (from, to) =>
+    supabase.client
+      .from('leads')
+      .select('id, phone, name, conversation_history, last_message_at')
+      .gte('last_message_at', hace7dias.toISOString())
+      .not('conversation_history', 'is', null)
+      .order('id', { ascending: true })
+      .range(from, to),
+    {
+      gzip: options.gzip,
+      mapRow: (lead: any) => ({
         lead_id: lead.id,
         phone: lead.phone,
         name: lead.name,
         last_message_at: lead.last_message_at,
         conversation_history: lead.conversation_history
-      }) + '\n';
-      convRows++;
+      })
     }
-  }
-
-  const convKey = `backups/conversations/${fecha}.jsonl`;
-  const convBytes = new TextEncoder().encode(convJsonl).length;
-  await r2.put(convKey, convJsonl, { httpMetadata: { contentType: 'application/jsonl' } });
+  );
 
   // 2. Export leads activos
-  const { data: activeLeads } = await supabase.client
-    .from('leads')
-    .select('*')
-    .not('status', 'in', '("fallen","inactive","lost")');
-
-  let leadsJsonl = '';
-  let leadsRows = 0;
-  if (activeLeads && activeLeads.length > 0) {
-    for (const lead of activeLeads) {
-      leadsJsonl += JSON.stringify(lead) + '\n';
-      leadsRows++;
-    }
-  }
-
-  const leadsKey = `backups/leads/${fecha}.jsonl`;
-  const leadsBytes = new TextEncoder().encode(leadsJsonl).length;
-  await r2.put(leadsKey, leadsJsonl, { httpMetadata: { contentType: 'application/jsonl' } });
+  const leads = await streamRowsToR2(r2, `backups/leads/${fecha}.${ext}`, (from, to) =>
+    supabase.client
+      .from('leads')
+      .select('*')
+      .not('status', 'in', '("fallen","inactive","lost")')
+      .order('id', { ascending: true })
+      .range(from, to),
+    { gzip: options.gzip }
+  );
 
   // 3. Guardar en backup_log
   try {
     await supabase.client.from('backup_log').insert([
-      { fecha, tipo: 'conversations', file_key: convKey, row_count: convRows, size_bytes: convBytes },
-      { fecha, tipo: 'leads', file_key: leadsKey, row_count: leadsRows, size_bytes: leadsBytes }
+      { fecha, tipo: 'conversations', file_key: conversations.key, row_count: conversations.rows, size_bytes: conversations.storedBytes },
+      { fecha, tipo: 'leads', file_key: leads.key, row_count: leads.rows, size_bytes: leads.storedBytes }
     ]);
   } catch (e) { console.error('Error inserting backup_log:', e); }
 
@@ -1078,20 +1127,16 @@ export async function backupSemanalR2(
 
     if (oldBackups && oldBackups.length > 60) { // 60 = 30 semanas × 2 tipos
       const toDelete = oldBackups.slice(0, oldBackups.length - 60);
-      for (const old of toDelete) {
-        try { await r2.delete(old.file_key); } catch (e) { console.error('Error deleting old R2 file:', e); }
-      }
+      // Un solo delete por lote de keys en vez de uno por archivo
+      try { await deleteR2Keys(r2, toDelete.map(o => o.file_key)); } catch (e) { console.error('Error deleting old R2 files:', e); }
       const idsToDelete = toDelete.map(o => o.id);
       await supabase.client.from('backup_log').delete().in('id', idsToDelete);
     }
   } catch (e) { console.error('Error in backup retention cleanup:', e); }
 
-  console.log(`💾 R2 Backup completado: ${convRows} conversations (${Math.round(convBytes/1024)}KB), ${leadsRows} leads (${Math.round(leadsBytes/1024)}KB)`);
+  console.log(`💾 R2 Backup completado: ${conversations.rows} conversations (${Math.round(conversations.bytes/1024)}KB → ${Math.round(conversations.storedBytes/1024)}KB), ${leads.rows} leads (${Math.round(leads.bytes/1024)}KB → ${Math.round(leads.storedBytes/1024)}KB)`);
 
-  return {
-    conversations: { key: convKey, rows: convRows, bytes: convBytes },
-    leads: { key: leadsKey, rows: leadsRows, bytes: leadsBytes }
-  };
+  return { conversations, leads };
 }
 
 export async function getBackupLog(supabase: SupabaseService): Promise<any[]> {
@@ -2059,7 +2059,11 @@ export async function seguimientoCredito(supabase: SupabaseService, meta: MetaWh
 // ═══════════════════════════════════════════════════════════════
 // BROADCAST QUEUE - Procesa broadcasts encolados
 // ═══════════════════════════════════════════════════════════════
-export async function procesarBroadcastQueue(supabase: SupabaseService, meta: MetaWhatsAppService): Promise<void> {
+export async function procesarBroadcastQueue(
+  supabase: SupabaseService,
+  meta: MetaWhatsAppService,
+  canAfford?: (subrequests: number) => boolean
+): Promise<void> {
   try {
     // 🚨 KILL SWITCH - Verificar si broadcasts están habilitados
     // Por seguridad, si no existe el config o hay error, NO procesar
@@ -2094,7 +2098,10 @@ export async function procesarBroadcastQueue(supabase: SupabaseService, meta: Me
       async (phone: string, message: string) => {
         // ⚠️ BROADCASTS usan rate limiting (bypassRateLimit = false)
         return meta.sendWhatsAppMessage(phone, message, false);
-      }
+      },
+      // 📦 Lote concurrente bajo el rate limit global, tracking en un solo insert
+      (jobs) => meta.sendMany(jobs),
+      canAfford
     );
 
     if (result.processed > 0) {
@@ -12,9 +12,11 @@
 import { SupabaseService } from '../services/supabase';
 import { MetaWhatsAppService } from '../services/meta-whatsapp';
 import { enviarMensajeTeamMember, EnviarMensajeTeamResult } from '../utils/teamMessaging';
+import { getEntityCache } from '../services/entityCache';
 import { enviarMensajeLead } from '../utils/leadMessaging';
 import { parseNotasSafe, formatVendorFeedback } from '../handlers/whatsapp-utils';
 import { logErrorToDB, enviarAlertaSistema } from './healthCheck';
+import { createDailyMetrics, summarizeDailyMetrics, summarizeRawByVendedor, avgResponseMinutes, emptyTotals, toDayKey, SALE_STATUSES } from '../services/dailyMetricsService';
 
 // ═══════════════════════════════════════════════════════════════
 // REPORTES CEO AUTOMÁTICOS
@@ -60,6 +62,15 @@ export async function enviarReporteDiarioCEO(supabase: SupabaseService, meta: Me
   // === QUERIES (parallelized with Promise.all) ===
   const inicioMes = new Date(hoy.getFullYear(), hoy.getMonth(), 1).toISOString();
 
+  // Conteos/revenue desde el rollup daily_metrics (1 query de filas pre-agregadas).
+  // Si la migración 010 no está aplicada, rollup = null y se usan las queries crudas.
+  const dayAyer = toDayKey(inicioAyer);
+  const daySemPasada = toDayKey(inicioSemPasada);
+  const dayMes = toDayKey(inicioMes);
+  const dayHoy = toDayKey(inicioHoy);
+  const rollup = await createDailyMetrics(supabase).getRange(dayMes < daySemPasada ? dayMes : daySemPasada, dayHoy);
+  const skip = Promise.resolve({ data: null as any[] | null });
+
   const [
     { data: leadsAyer },
     { data: leadsSemPasada },
@@ -75,36 +86,80 @@ export async function enviarReporteDiarioCEO(supabase: SupabaseService, meta: Me
     { data: leadsMes },
     { data: followupsAyer }
   ] = await Promise.all([
-    supabase.client.from('leads').select('*, team_members:assigned_to(name)').gte('created_at', inicioAyer).lt('created_at', inicioHoy),
-    supabase.client.from('leads').select('id').gte('created_at', inicioSemPasada).lt('created_at', finSemPasada),
-    supabase.client.from('leads').select('*, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioAyer).lt('status_changed_at', inicioHoy),
-    supabase.client.from('leads').select('id, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioSemPasada).lt('status_changed_at', finSemPasada),
-    supabase.client.from('appointments').select('*').eq('scheduled_date', ayer.toISOString().split('T')[0]),
+    rollup ? skip : supabase.client.from('leads').select('*, team_members:assigned_to(name)').gte('created_at', inicioAyer).lt('created_at', inicioHoy),
+    rollup ? skip : supabase.client.from('leads').select('id').gte('created_at', inicioSemPasada).lt('created_at', finSemPasada),
+    rollup ? skip : supabase.client.from('leads').select('*, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioAyer).lt('status_changed_at', inicioHoy),
+    rollup ? skip : supabase.client.from('leads').select('id, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioSemPasada).lt('status_changed_at', finSemPasada),
+    rollup ? skip : supabase.client.from('appointments').select('*').eq('scheduled_date', ayer.toISOString().split('T')[0]),
     supabase.client.from('appointments').select('*, team_members(name), leads(name, phone)').eq('scheduled_date', hoy.toISOString().split('T')[0]).eq('status', 'scheduled'),
     supabase.client.from('leads').select('*, properties(price)').in('status', ['negotiation', 'reserved', 'scheduled', 'visited']),
     supabase.client.from('leads').select('id').eq('status', 'new').lt('created_at', inicioAyer),
-    supabase.client.from('leads').select('id, lost_reason').eq('status', 'lost').gte('status_changed_at', inicioAyer).lt('status_changed_at', inicioHoy),
+    rollup ? skip : supabase.client.from('leads').select('id, lost_reason').eq('status', 'lost').gte('status_changed_at', inicioAyer).lt('status_changed_at', inicioHoy),
     supabase.client.from('team_members').select('id, name').eq('role', 'vendedor').eq('active', true),
-    supabase.client.from('leads').select('*, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioMes),
-    supabase.client.from('leads').select('id').gte('created_at', inicioMes),
+    rollup ? skip : supabase.client.from('leads').select('*, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioMes),
+    rollup ? skip : supabase.client.from('leads').select('id').gte('created_at', inicioMes),
     supabase.client.from('followup_approvals').select('status').gte('created_at', inicioAyer).lt('created_at', inicioHoy)
   ]);
 
   // === CÁLCULOS ===
-  let revenueAyer = 0, pipelineValueDiario = 0;
-  cierresAyer?.forEach(c => revenueAyer += c.properties?.price || 2000000);
-  pipelineDiario?.forEach(p => pipelineValueDiario += p.properties?.price || 2000000);
+  let revenueAyer = 0, pipelineValueDiario = 0, revenueMes = 0;
+  let leadsAyerCount = 0, leadsSemPasadaCount = 0, cierresAyerCount = 0, cierresSemPasadaCount = 0;
+  let citasAyerCompletadas = 0, citasAyerTotal = 0, perdidosAyerCount = 0, cierresMesCount = 0, leadsMesCount = 0;
+  const rendimientoAyer: string[] = [];
 
-  const leadsAyerCount = leadsAyer?.length || 0;
-  const leadsSemPasadaCount = leadsSemPasada?.length || 0;
-  const cierresAyerCount = cierresAyer?.length || 0;
-  const cierresSemPasadaCount = cierresSemPasada?.length || 0;
+  if (rollup) {
+    const mAyer = summarizeDailyMetrics(rollup, dayAyer, dayAyer);
+    const mSemPasada = summarizeDailyMetrics(rollup, daySemPasada, daySemPasada);
+    const mMes = summarizeDailyMetrics(rollup, dayMes, dayHoy).totals;
+
+    leadsAyerCount = mAyer.totals.leads;
+    cierresAyerCount = mAyer.totals.sales;
+    revenueAyer = mAyer.totals.revenue;
+    citasAyerCompletadas = mAyer.totals.appointmentsCompleted;
+    citasAyerTotal = mAyer.totals.appointments;
+    perdidosAyerCount = mAyer.totals.lost;
+    leadsSemPasadaCount = mSemPasada.totals.leads;
+    cierresSemPasadaCount = mSemPasada.totals.sales;
+    cierresMesCount = mMes.sales;
+    revenueMes = mMes.revenue;
+    leadsMesCount = mMes.leads;
+
+    // Rendimiento vendedores ayer
+    vendedoresDiario?.forEach(v => {
+      const leadsV = mAyer.byVendedor[v.id]?.leads || 0;
+      const cierresV = mAyer.byVendedor[v.id]?.sales || 0;
+      if (leadsV > 0 || cierresV > 0) {
+        rendimientoAyer.push(`• ${v.name?.split(' ')[0] || 'V'}: ${cierresV}c/${leadsV}L`);
+      }
+    });
+  } else {
+    cierresAyer?.forEach(c => revenueAyer += c.properties?.price || 2000000);
+    cierresMes?.forEach(c => revenueMes += c.properties?.price || 2000000);
+
+    leadsAyerCount = leadsAyer?.length || 0;
+    leadsSemPasadaCount = leadsSemPasada?.length || 0;
+    cierresAyerCount = cierresAyer?.length || 0;
+    cierresSemPasadaCount = cierresSemPasada?.length || 0;
+    citasAyerCompletadas = citasAyer?.filter(c => c.status === 'completed').length || 0;
+    citasAyerTotal = citasAyer?.length || 0;
+    perdidosAyerCount = perdidosAyer?.length || 0;
+    cierresMesCount = cierresMes?.length || 0;
+    leadsMesCount = leadsMes?.length || 0;
+
+    // Rendimiento vendedores ayer
+    vendedoresDiario?.forEach(v => {
+      const leadsV = leadsAyer?.filter(l => l.assigned_to === v.id).length || 0;
+      const cierresV = cierresAyer?.filter(c => c.assigned_to === v.id).length || 0;
+      if (leadsV > 0 || cierresV > 0) {
+        rendimientoAyer.push(`• ${v.name?.split(' ')[0] || 'V'}: ${cierresV}c/${leadsV}L`);
+      }
+    });
+  }
+  pipelineDiario?.forEach(p => pipelineValueDiario += p.properties?.price || 2000000);
 
   const calcVarDiario = (a: number, b: number) => b === 0 ? (a > 0 ? '↑' : '→') : a > b ? `↑${Math.round((a-b)/b*100)}%` : a < b ? `↓${Math.round((b-a)/b*100)}%` : '→';
 
   // Citas ayer stats
-  const citasAyerCompletadas = citasAyer?.filter(c => c.status === 'completed').length || 0;
-  const citasAyerTotal = citasAyer?.length || 0;
   const showRateAyer = citasAyerTotal > 0 ? Math.round((citasAyerCompletadas / citasAyerTotal) * 100) : 0;
 
   // Pipeline por etapa
@@ -112,26 +167,12 @@ export async function enviarReporteDiarioCEO(supabase: SupabaseService, meta: Me
   const reservadosDiario = pipelineDiario?.filter(p => p.status === 'reserved').length || 0;
 
   // Cálculos proyección
-  let revenueMes = 0;
-  cierresMes?.forEach(c => revenueMes += c.properties?.price || 2000000);
-  const cierresMesCount = cierresMes?.length || 0;
-  const leadsMesCount = leadsMes?.length || 0;
   const diaActual = hoy.getDate();
   const diasEnMes = new Date(hoy.getFullYear(), hoy.getMonth() + 1, 0).getDate();
   const diasRestantes = diasEnMes - diaActual;
   const proyeccionCierres = diaActual > 0 ? Math.round((cierresMesCount / diaActual) * diasEnMes) : 0;
   const proyeccionRevenue = diaActual > 0 ? (revenueMes / diaActual) * diasEnMes : 0;
 
-  // Rendimiento vendedores ayer
-  const rendimientoAyer: string[] = [];
-  vendedoresDiario?.forEach(v => {
-    const leadsV = leadsAyer?.filter(l => l.assigned_to === v.id).length || 0;
-    const cierresV = cierresAyer?.filter(c => c.assigned_to === v.id).length || 0;
-    if (leadsV > 0 || cierresV > 0) {
-      rendimientoAyer.push(`• ${v.name?.split(' ')[0] || 'V'}: ${cierresV}c/${leadsV}L`);
-    }
-  });
-
   // Citas de hoy detalle
   const citasHoyDetalle: string[] = [];
   citasHoy?.slice(0, 5).forEach(c => {
@@ -148,7 +189,7 @@ export async function enviarReporteDiarioCEO(supabase: SupabaseService, meta: Me
   // Alertas
   const alertasDiarias: string[] = [];
   if (estancados && estancados.length > 0) alertasDiarias.push(`• ${estancados.length} leads sin contactar >24h`);
-  if (perdidosAyer && perdidosAyer.length > 0) alertasDiarias.push(`• ${perdidosAyer.length} leads perdidos ayer`);
+  if (perdidosAyerCount > 0) alertasDiarias.push(`• ${perdidosAyerCount} leads perdidos ayer`);
   if (followupsPendientesAyer > 0) alertasDiarias.push(`• ${followupsPendientesAyer} follow-ups sin aprobar`);
 
   // === CONSTRUIR MENSAJE ===
@@ -237,6 +278,16 @@ export async function enviarReporteSemanalCEO(supabase: SupabaseService, meta: M
   // Queries (parallelized with Promise.all)
   const inicioMes = new Date(hoy.getFullYear(), hoy.getMonth(), 1).toISOString();
 
+  // Conteos/revenue desde el rollup daily_metrics (granularidad día).
+  // Si la migración 010 no está aplicada, rollup = null y se usan las queries crudas.
+  const daySemana = toDayKey(inicioSemana);
+  const daySemanaAnt = toDayKey(inicioSemanaAnterior);
+  const dayFinSemanaAnt = toDayKey(new Date(inicioSemana.getTime() - 24 * 60 * 60 * 1000));
+  const dayMes = toDayKey(inicioMes);
+  const dayHoy = toDayKey(hoy);
+  const rollup = await createDailyMetrics(supabase).getRange(dayMes < daySemanaAnt ? dayMes : daySemanaAnt, dayHoy);
+  const skip = Promise.resolve({ data: null as any[] | null });
+
   const [
     { data: leadsSemana },
     { data: cierresSemana },
@@ -249,35 +300,86 @@ export async function enviarReporteSemanalCEO(supabase: SupabaseService, meta: M
     { data: cierresMes },
     { data: leadsMes }
   ] = await Promise.all([
-    supabase.client.from('leads').select('*, team_members:assigned_to(name)').gte('created_at', inicioSemana.toISOString()),
-    supabase.client.from('leads').select('*, properties(price), team_members:assigned_to(name)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioSemana.toISOString()),
-    supabase.client.from('appointments').select('*').gte('scheduled_date', inicioSemana.toISOString().split('T')[0]),
-    supabase.client.from('leads').select('id').gte('created_at', inicioSemanaAnterior.toISOString()).lt('created_at', inicioSemana.toISOString()),
-    supabase.client.from('leads').select('id, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioSemanaAnterior.toISOString()).lt('status_changed_at', inicioSemana.toISOString()),
+    // Con rollup solo se necesitan los tiempos de primer contacto
+    rollup
+      ? supabase.client.from('leads').select('created_at, first_contact_at').gte('created_at', inicioSemana.toISOString())
+      : supabase.client.from('leads').select('*, team_members:assigned_to(name)').gte('created_at', inicioSemana.toISOString()),
+    rollup ? skip : supabase.client.from('leads').select('*, properties(price), team_members:assigned_to(name)').in('status', SALE_STATUSES).gte('status_changed_at', inicioSemana.toISOString()),
+    rollup ? skip : supabase.client.from('appointments').select('*').gte('scheduled_date', inicioSemana.toISOString().split('T')[0]),
+    rollup ? skip : supabase.client.from('leads').select('id').gte('created_at', inicioSemanaAnterior.toISOString()).lt('created_at', inicioSemana.toISOString()),
+    rollup ? skip : supabase.client.from('leads').select('id, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioSemanaAnterior.toISOString()).lt('status_changed_at', inicioSemana.toISOString()),
     supabase.client.from('leads').select('id, lost_reason').eq('status', 'lost').gte('status_changed_at', inicioSemana.toISOString()),
     supabase.client.from('leads').select('*, properties(price)').in('status', ['negotiation', 'reserved', 'scheduled', 'visited']),
     supabase.client.from('team_members').select('id, name').eq('role', 'vendedor').eq('active', true),
-    supabase.client.from('leads').select('*, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioMes),
-    supabase.client.from('leads').select('id').gte('created_at', inicioMes)
+    rollup ? skip : supabase.client.from('leads').select('*, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioMes),
+    rollup ? skip : supabase.client.from('leads').select('id').gte('created_at', inicioMes)
   ]);
 
   // Cálculos básicos
   let revenue = 0, revenueAnt = 0, pipelineValue = 0, revenueMes = 0;
-  cierresSemana?.forEach(c => revenue += c.properties?.price || 2000000);
-  cierresSemanaAnt?.forEach(c => revenueAnt += (c as any).properties?.price || 2000000);
-  pipeline?.forEach(p => pipelineValue += p.properties?.price || 2000000);
-  cierresMes?.forEach(c => revenueMes += c.properties?.price || 2000000);
-
-  const leadsActual = leadsSemana?.length || 0;
-  const leadsAnterior = leadsSemanaAnt?.length || 0;
-  const cierresActual = cierresSemana?.length || 0;
-  const cierresAnterior = cierresSemanaAnt?.length || 0;
+  let leadsActual = 0, leadsAnterior = 0, cierresActual = 0, cierresAnterior = 0, cierresMesCount = 0;
+  let citasTotal = 0, citasCompletadas = 0, citasCanceladas = 0;
+  const fuenteCount: Record<string, number> = {};
+  const rendimiento: { nombre: string; cierres: number; citas: number; leads: number; revenue: number }[] = [];
   const perdidosCount = perdidosSemana?.length || 0;
 
-  // Citas stats
-  const citasTotal = citasSemana?.length || 0;
-  const citasCompletadas = citasSemana?.filter(c => c.status === 'completed').length || 0;
-  const citasCanceladas = citasSemana?.filter(c => c.status === 'cancelled').length || 0;
+  if (rollup) {
+    const mSemana = summarizeDailyMetrics(rollup, daySemana, dayHoy);
+    const mAnt = summarizeDailyMetrics(rollup, daySemanaAnt, dayFinSemanaAnt).totals;
+    const mMes = summarizeDailyMetrics(rollup, dayMes, dayHoy).totals;
+
+    revenue = mSemana.totals.revenue;
+    revenueAnt = mAnt.revenue;
+    revenueMes = mMes.revenue;
+    leadsActual = mSemana.totals.leads;
+    leadsAnterior = mAnt.leads;
+    cierresActual = mSemana.totals.sales;
+    cierresAnterior = mAnt.sales;
+    cierresMesCount = mMes.sales;
+    citasTotal = mSemana.totals.appointments;
+    citasCompletadas = mSemana.totals.appointmentsCompleted;
+    citasCanceladas = mSemana.totals.appointmentsCancelled;
+
+    for (const [fuente, t] of Object.entries(mSemana.bySource)) {
+      if (t.leads > 0) fuenteCount[fuente || 'Otro'] = (fuenteCount[fuente || 'Otro'] || 0) + t.leads;
+    }
+    vendedores?.forEach(v => {
+      const t = mSemana.byVendedor[v.id];
+      if (t && (t.leads > 0 || t.sales > 0)) {
+        rendimiento.push({ nombre: v.name?.split(' ')[0] || 'V', cierres: t.sales, citas: t.appointmentsCompleted, leads: t.leads, revenue: t.revenue });
+      }
+    });
+  } else {
+    cierresSemana?.forEach(c => revenue += c.properties?.price || 2000000);
+    cierresSemanaAnt?.forEach(c => revenueAnt += (c as any).properties?.price || 2000000);
+    cierresMes?.forEach(c => revenueMes += c.properties?.price || 2000000);
+
+    leadsActual = leadsSemana?.length || 0;
+    leadsAnterior = leadsSemanaAnt?.length || 0;
+    cierresActual = cierresSemana?.length || 0;
+    cierresAnterior = cierresSemanaAnt?.length || 0;
+    cierresMesCount = cierresMes?.length || 0;
+
+    // Citas stats
+    citasTotal = citasSemana?.length || 0;
+    citasCompletadas = citasSemana?.filter(c => c.status === 'completed').length || 0;
+    citasCanceladas = citasSemana?.filter(c => c.status === 'cancelled').length || 0;
+
+    leadsSemana?.forEach(l => { const f = l.source || 'Otro'; fuenteCount[f] = (fuenteCount[f] || 0) + 1; });
+
+    // Rendimiento vendedores
+    vendedores?.forEach(v => {
+      const l = leadsSemana?.filter(x => x.assigned_to === v.id).length || 0;
+      const c = cierresSemana?.filter(x => x.assigned_to === v.id).length || 0;
+      let rev = 0;
+      cierresSemana?.filter(x => x.assigned_to === v.id).forEach(x => rev += x.properties?.price || 2000000);
+      const ci = citasSemana?.filter(x => x.team_member_id === v.id && x.status === 'completed').length || 0;
+      if (l > 0 || c > 0) rendimiento.push({ nombre: v.name?.split(' ')[0] || 'V', cierres: c, citas: ci, leads: l, revenue: rev });
+    });
+  }
+  pipeline?.forEach(p => pipelineValue += p.properties?.price || 2000000);
+  rendimiento.sort((a, b) => b.cierres - a.cierres || b.revenue - a.revenue);
+
   const showRate = citasTotal > 0 ? Math.round((citasCompletadas / citasTotal) * 100) : 0;
 
   // Conversión y métricas
@@ -296,15 +398,12 @@ export async function enviarReporteSemanalCEO(supabase: SupabaseService, meta: M
   // Proyección
   const diaActual = hoy.getDate();
   const diasEnMes = new Date(hoy.getFullYear(), hoy.getMonth() + 1, 0).getDate();
-  const cierresMesCount = cierresMes?.length || 0;
   const proyeccionCierres = diaActual > 0 ? Math.round((cierresMesCount / diaActual) * diasEnMes) : 0;
   const proyeccionRevenue = diaActual > 0 ? (revenueMes / diaActual) * diasEnMes : 0;
 
   const calcVar = (a: number, b: number) => b === 0 ? (a > 0 ? '↑' : '→') : a > b ? `↑${Math.round((a-b)/b*100)}%` : a < b ? `↓${Math.round((b-a)/b*100)}%` : '→';
 
   // Top fuentes
-  const fuenteCount: Record<string, number> = {};
-  leadsSemana?.forEach(l => { const f = l.source || 'Otro'; fuenteCount[f] = (fuenteCount[f] || 0) + 1; });
   const topFuentes = Object.entries(fuenteCount).sort((a, b) => b[1] - a[1]).slice(0, 3);
 
   // Razones de pérdida
@@ -312,18 +411,6 @@ export async function enviarReporteSemanalCEO(supabase: SupabaseService, meta: M
   perdidosSemana?.forEach(l => { const r = l.lost_reason || 'Sin especificar'; razonesCount[r] = (razonesCount[r] || 0) + 1; });
   const topRazones = Object.entries(razonesCount).sort((a, b) => b[1] - a[1]).slice(0, 2);
 
-  // Rendimiento vendedores
-  const rendimiento: { nombre: string; cierres: number; citas: number; leads: number; revenue: number }[] = [];
-  vendedores?.forEach(v => {
-    const l = leadsSemana?.filter(x => x.assigned_to === v.id).length || 0;
-    const c = cierresSemana?.filter(x => x.assigned_to === v.id).length || 0;
-    let rev = 0;
-    cierresSemana?.filter(x => x.assigned_to === v.id).forEach(x => rev += x.properties?.price || 2000000);
-    const ci = citasSemana?.filter(x => x.team_member_id === v.id && x.status === 'completed').length || 0;
-    if (l > 0 || c > 0) rendimiento.push({ nombre: v.name?.split(' ')[0] || 'V', cierres: c, citas: ci, leads: l, revenue: rev });
-  });
-  rendimiento.sort((a, b) => b.cierres - a.cierres || b.revenue - a.revenue);
-
   // Insights
   const insights: string[] = [];
   if (tiempoRespProm > 0 && tiempoRespProm <= 30) insights.push('✅ Tiempo respuesta excelente');
@@ -453,6 +540,19 @@ export async function enviarReporteMensualCEO(supabase: SupabaseService, meta: M
 
     // ═══ DATOS DEL MES REPORTADO (parallelized with Promise.all) ═══
 
+    // Conteos/revenue desde el rollup daily_metrics: mes reportado + anterior en
+    // un rango, YoY aparte para no leer 13 meses. null → queries crudas.
+    const dayMesAnterior = toDayKey(inicioMesAnterior);
+    const dayInicioMes = toDayKey(inicioMesReporte);
+    const dayFinMes = toDayKey(finMesReporte);
+    const dailyMetrics = createDailyMetrics(supabase);
+    const [rollupMeses, rollupYoY] = await Promise.all([
+      dailyMetrics.getRange(dayMesAnterior, dayFinMes),
+      dailyMetrics.getRange(toDayKey(inicioMesYoY), toDayKey(finMesYoY))
+    ]);
+    const rollup = rollupMeses && rollupYoY ? { meses: rollupMeses, yoy: rollupYoY } : null;
+    const skip = Promise.resolve({ data: null as any[] | null });
+
     const [
       { data: leadsMes },
       { data: leadsMesAnterior },
@@ -466,42 +566,42 @@ export async function enviarReporteMensualCEO(supabase: SupabaseService, meta: M
       { data: vendedores }
     ] = await Promise.all([
       // Leads del mes
-      supabase.client.from('leads').select('*, team_members:assigned_to(name)')
+      rollup ? skip : supabase.client.from('leads').select('*, team_members:assigned_to(name)')
         .gte('created_at', inicioMesReporte.toISOString())
         .lte('created_at', finMesReporte.toISOString()),
       // Leads mes anterior (MoM)
-      supabase.client.from('leads').select('id')
+      rollup ? skip : supabase.client.from('leads').select('id')
         .gte('created_at', inicioMesAnterior.toISOString())
         .lte('created_at', finMesAnterior.toISOString()),
       // Leads YoY (mismo mes año anterior)
-      supabase.client.from('leads').select('id')
+      rollup ? skip : supabase.client.from('leads').select('id')
         .gte('created_at', inicioMesYoY.toISOString())
         .lte('created_at', finMesYoY.toISOString()),
       // Cierres del mes
-      supabase.client.from('leads').select('*, properties(price, name), team_members:assigned_to(name)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('*, properties(price, name), team_members:assigned_to(name)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioMesReporte.toISOString())
         .lte('status_changed_at', finMesReporte.toISOString()),
       // Cierres mes anterior (MoM)
-      supabase.client.from('leads').select('id, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('id, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioMesAnterior.toISOString())
         .lte('status_changed_at', finMesAnterior.toISOString()),
       // Cierres YoY
-      supabase.client.from('leads').select('id, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('id, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioMesYoY.toISOString())
         .lte('status_changed_at', finMesYoY.toISOString()),
       // Pipeline actual (forecast)
       supabase.client.from('leads').select('*, properties(price)')
         .in('status', ['negotiation', 'reserved', 'scheduled', 'visited']),
-      // Leads perdidos
+      // Leads perdidos (las razones no están en el rollup)
       supabase.client.from('leads').select('id, lost_reason')
         .eq('status', 'lost')
         .gte('status_changed_at', inicioMesReporte.toISOString())
         .lte('status_changed_at', finMesReporte.toISOString()),
       // Citas del mes
-      supabase.client.from('appointments').select('*')
+      rollup ? skip : supabase.client.from('appointments').select('*')
         .gte('scheduled_date', inicioMesReporte.toISOString().split('T')[0])
         .lte('scheduled_date', finMesReporte.toISOString().split('T')[0]),
       // Vendedores con stats
@@ -512,22 +612,21 @@ export async function enviarReporteMensualCEO(supabase: SupabaseService, meta: M
 
     // ═══ CÁLCULOS ═══
 
-    // Revenue
-    let revenueMes = 0;
-    for (const c of cierresMes || []) {
-      revenueMes += c.properties?.price || 2000000;
-    }
+    // Totales del mes, mes anterior y YoY (mismas reglas en rollup y fallback)
+    const mMes = rollup
+      ? summarizeDailyMetrics(rollup.meses, dayInicioMes, dayFinMes)
+      : summarizeRawByVendedor(leadsMes, cierresMes, citasMes);
+    const mAnterior = rollup
+      ? summarizeDailyMetrics(rollup.meses, dayMesAnterior, toDayKey(finMesAnterior)).totals
+      : summarizeRawByVendedor(leadsMesAnterior, cierresMesAnterior, []).totals;
+    const mYoY = rollup
+      ? summarizeDailyMetrics(rollup.yoy).totals
+      : summarizeRawByVendedor(leadsYoY, cierresYoY, []).totals;
 
-    let revenueMesAnterior = 0;
-    for (const c of cierresMesAnterior || []) {
-      revenueMesAnterior += c.properties?.price || 2000000;
-    }
-
-    // YoY Revenue
-    let revenueYoY = 0;
-    for (const c of cierresYoY || []) {
-      revenueYoY += c.properties?.price || 2000000;
-    }
+    // Revenue
+    const revenueMes = mMes.totals.revenue;
+    const revenueMesAnterior = mAnterior.revenue;
+    const revenueYoY = mYoY.revenue;
 
     // Pipeline value
     let pipelineValue = 0;
@@ -536,12 +635,12 @@ export async function enviarReporteMensualCEO(supabase: SupabaseService, meta: M
     }
 
     // Variaciones
-    const leadsActual = leadsMes?.length || 0;
-    const leadsPrev = leadsMesAnterior?.length || 0;
-    const leadsYoYCount = leadsYoY?.length || 0;
-    const cierresActual = cierresMes?.length || 0;
-    const cierresPrev = cierresMesAnterior?.length || 0;
-    const cierresYoYCount = cierresYoY?.length || 0;
+    const leadsActual = mMes.totals.leads;
+    const leadsPrev = mAnterior.leads;
+    const leadsYoYCount = mYoY.leads;
+    const cierresActual = mMes.totals.sales;
+    const cierresPrev = mAnterior.sales;
+    const cierresYoYCount = mYoY.sales;
     const perdidosCount = leadsPerdidos?.length || 0;
 
     // Función para calcular variación con flechas
@@ -551,16 +650,23 @@ export async function enviarReporteMensualCEO(supabase: SupabaseService, meta: M
     const conversionMes = leadsActual > 0 ? Math.round((cierresActual / leadsActual) * 100) : 0;
 
     // Citas stats
-    const citasCompletadas = citasMes?.filter(c => c.status === 'completed').length || 0;
-    const showRate = citasMes && citasMes.length > 0
-      ? Math.round((citasCompletadas / citasMes.length) * 100)
+    const citasTotal = mMes.totals.appointments;
+    const citasCompletadas = mMes.totals.appointmentsCompleted;
+    const showRate = citasTotal > 0
+      ? Math.round((citasCompletadas / citasTotal) * 100)
       : 0;
 
     // Leads por fuente
     const porFuente: Record<string, number> = {};
-    for (const l of leadsMes || []) {
-      const fuente = l.source || 'Directo';
-      porFuente[fuente] = (porFuente[fuente] || 0) + 1;
+    if (rollup) {
+      for (const [fuente, t] of Object.entries(summarizeDailyMetrics(rollup.meses, dayInicioMes, dayFinMes).bySource)) {
+        if (t.leads > 0) porFuente[fuente || 'Directo'] = (porFuente[fuente || 'Directo'] || 0) + t.leads;
+      }
+    } else {
+      for (const l of leadsMes || []) {
+        const fuente = l.source || 'Directo';
+        porFuente[fuente] = (porFuente[fuente] || 0) + 1;
+      }
     }
     const fuentesOrdenadas = Object.entries(porFuente).sort((a, b) => b[1] - a[1]).slice(0, 3);
 
@@ -583,32 +689,15 @@ export async function enviarReporteMensualCEO(supabase: SupabaseService, meta: M
     const convCitaCierre = citasCompletadas > 0 ? Math.round((cierresActual / citasCompletadas) * 100) : 0;
 
     // Tiempo de respuesta promedio
-    let tiemposRespuesta: number[] = [];
-    for (const l of leadsMes || []) {
-      if (l.first_response_at && l.created_at) {
-        const created = new Date(l.created_at).getTime();
-        const responded = new Date(l.first_response_at).getTime();
-        const diffMin = (responded - created) / 60000;
-        if (diffMin > 0 && diffMin < 1440) {
-          tiemposRespuesta.push(diffMin);
-        }
-      }
-    }
-    const tiempoPromedioMin = tiemposRespuesta.length > 0
-      ? Math.round(tiemposRespuesta.reduce((a, b) => a + b, 0) / tiemposRespuesta.length)
-      : 0;
+    const tiempoPromedioMin = Math.round(avgResponseMinutes(mMes.totals));
     const tiempoRespuestaStr = tiempoPromedioMin > 60
       ? `${Math.floor(tiempoPromedioMin/60)}h ${tiempoPromedioMin%60}m`
       : `${tiempoPromedioMin}min`;
 
     // Vendedores con revenue
     const vendedoresConCierres = (vendedores || []).map(v => {
-      const cierresV = cierresMes?.filter(c => c.assigned_to === v.id) || [];
-      let revenueV = 0;
-      for (const c of cierresV) {
-        revenueV += c.properties?.price || 2000000;
-      }
-      return { ...v, cierresCount: cierresV.length, revenueV };
+      const totalsV = mMes.byVendedor[v.id];
+      return { ...v, cierresCount: totalsV?.sales || 0, revenueV: totalsV?.revenue || 0 };
     }).sort((a, b) => b.revenueV - a.revenueV);
 
     const rendVendedoresConRevenue: string[] = [];
@@ -671,7 +760,7 @@ export async function enviarReporteMensualCEO(supabase: SupabaseService, meta: M
 📈 *CONVERSIONES*
 ━━━━━━━━━━━━━━━━━━━━━
 • Leads: ${leadsActual} ${calcVar(leadsActual, leadsPrev)}
-• Citas: ${citasMes?.length || 0} (show: *${showRate}%*)
+• Citas: ${citasTotal} (show: *${showRate}%*)
 • Lead→Cierre: *${conversionMes}%*
 • Cita→Cierre: *${convCitaCierre}%*
 
@@ -763,6 +852,15 @@ export async function enviarReporteSemanalVendedores(supabase: SupabaseService,
     const finSemAnterior = new Date(finSemPasada);
     finSemAnterior.setDate(finSemPasada.getDate() - 7);
 
+    // Conteos desde el rollup daily_metrics (ambas semanas en un rango).
+    // Si no está disponible, rollup = null y se usan las queries crudas.
+    const daySemAnterior = toDayKey(inicioSemAnterior);
+    const dayFinSemAnterior = toDayKey(finSemAnterior);
+    const daySemPasada = toDayKey(inicioSemPasada);
+    const dayFinSemPasada = toDayKey(finSemPasada);
+    const rollup = await createDailyMetrics(supabase).getRange(daySemAnterior, dayFinSemPasada);
+    const skip = Promise.resolve({ data: null as any[] | null });
+
     // Datos globales de la semana (parallelized with Promise.all)
     const [
       { data: todosLeadsSem },
@@ -771,27 +869,32 @@ export async function enviarReporteSemanalVendedores(supabase: SupabaseService,
       { data: todosLeadsSemAnt },
       { data: todosCierresSemAnt }
     ] = await Promise.all([
-      supabase.client.from('leads').select('*, properties(price)')
+      rollup ? skip : supabase.client.from('leads').select('*, properties(price)')
         .gte('created_at', inicioSemPasada.toISOString()).lte('created_at', finSemPasada.toISOString()),
-      supabase.client.from('leads').select('*, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('*, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioSemPasada.toISOString()).lte('status_changed_at', finSemPasada.toISOString()),
-      supabase.client.from('appointments').select('*')
+      rollup ? skip : supabase.client.from('appointments').select('*')
         .gte('scheduled_date', inicioSemPasada.toISOString().split('T')[0])
         .lte('scheduled_date', finSemPasada.toISOString().split('T')[0]),
-      supabase.client.from('leads').select('id, assigned_to')
+      rollup ? skip : supabase.client.from('leads').select('id, assigned_to')
         .gte('created_at', inicioSemAnterior.toISOString()).lte('created_at', finSemAnterior.toISOString()),
-      supabase.client.from('leads').select('id, assigned_to, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('id, assigned_to, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioSemAnterior.toISOString()).lte('status_changed_at', finSemAnterior.toISOString())
     ]);
 
+    const mSem = rollup
+      ? summarizeDailyMetrics(rollup, daySemPasada, dayFinSemPasada)
+      : summarizeRawByVendedor(todosLeadsSem, todosCierresSem, todasCitasSem);
+    const mSemAnt = rollup
+      ? summarizeDailyMetrics(rollup, daySemAnterior, dayFinSemAnterior)
+      : summarizeRawByVendedor(todosLeadsSemAnt, todosCierresSemAnt, []);
+
     // Calcular ranking por revenue
     const vendedoresConRevenue = vendedores.map(v => {
-      const cierresV = todosCierresSem?.filter(c => c.assigned_to === v.id) || [];
-      let revenueV = 0;
-      cierresV.forEach(c => revenueV += c.properties?.price || 2000000);
-      return { ...v, cierresCount: cierresV.length, revenueV };
+      const totalsV = mSem.byVendedor[v.id];
+      return { ...v, cierresCount: totalsV?.sales || 0, revenueV: totalsV?.revenue || 0 };
     }).sort((a, b) => b.revenueV - a.revenueV);
 
     // Función para calcular variación
@@ -806,31 +909,23 @@ export async function enviarReporteSemanalVendedores(supabase: SupabaseService,
     for (const vendedor of vendedores) {
       if (!vendedor.phone) continue;
 
-      // Datos individuales del vendedor
-      const leadsVendedor = todosLeadsSem?.filter(l => l.assigned_to === vendedor.id) || [];
-      const cierresVendedor = todosCierresSem?.filter(c => c.assigned_to === vendedor.id) || [];
-      const citasVendedor = todasCitasSem?.filter(c => c.vendedor_id === vendedor.id) || [];
-
-      // Datos semana anterior
-      const leadsVendedorAnt = todosLeadsSemAnt?.filter(l => l.assigned_to === vendedor.id) || [];
-      const cierresVendedorAnt = todosCierresSemAnt?.filter(c => c.assigned_to === vendedor.id) || [];
+      // Datos individuales del vendedor (semana y semana anterior)
+      const semV = mSem.byVendedor[vendedor.id] || emptyTotals();
+      const semAntV = mSemAnt.byVendedor[vendedor.id] || emptyTotals();
 
       // Cálculos
-      const leadsCount = leadsVendedor.length;
-      const leadsCountAnt = leadsVendedorAnt.length;
-      const cierresCount = cierresVendedor.length;
-      const cierresCountAnt = cierresVendedorAnt.length;
-
-      let revenueVendedor = 0;
-      cierresVendedor.forEach(c => revenueVendedor += c.properties?.price || 2000000);
+      const leadsCount = semV.leads;
+      const leadsCountAnt = semAntV.leads;
+      const cierresCount = semV.sales;
+      const cierresCountAnt = semAntV.sales;
 
-      let revenueVendedorAnt = 0;
-      cierresVendedorAnt.forEach(c => revenueVendedorAnt += c.properties?.price || 2000000);
+      const revenueVendedor = semV.revenue;
+      const revenueVendedorAnt = semAntV.revenue;
 
       // Citas
-      const citasTotal = citasVendedor.length;
-      const citasCompletadas = citasVendedor.filter(c => c.status === 'completed').length;
-      const citasCanceladas = citasVendedor.filter(c => c.status === 'cancelled').length;
+      const citasTotal = semV.appointments;
+      const citasCompletadas = semV.appointmentsCompleted;
+      const citasCanceladas = semV.appointmentsCancelled;
       const showRate = citasTotal > 0 ? Math.round((citasCompletadas / citasTotal) * 100) : 0;
 
       // Conversiones
@@ -838,20 +933,7 @@ export async function enviarReporteSemanalVendedores(supabase: SupabaseService,
       const convCitaCierre = citasCompletadas > 0 ? Math.round((cierresCount / citasCompletadas) * 100) : 0;
 
       // Tiempo de respuesta promedio
-      let tiemposRespuesta: number[] = [];
-      for (const l of leadsVendedor) {
-        if (l.first_response_at && l.created_at) {
-          const created = new Date(l.created_at).getTime();
-          const responded = new Date(l.first_response_at).getTime();
-          const diffMin = (responded - created) / 60000;
-          if (diffMin > 0 && diffMin < 1440) {
-            tiemposRespuesta.push(diffMin);
-          }
-        }
-      }
-      const tiempoPromedioMin = tiemposRespuesta.length > 0
-        ? Math.round(tiemposRespuesta.reduce((a, b) => a + b, 0) / tiemposRespuesta.length)
-        : 0;
+      const tiempoPromedioMin = Math.round(avgResponseMinutes(semV));
       const tiempoRespuestaStr = tiempoPromedioMin > 60
         ? `${Math.floor(tiempoPromedioMin/60)}h ${tiempoPromedioMin%60}m`
         : `${tiempoPromedioMin}min`;
@@ -863,8 +945,7 @@ export async function enviarReporteSemanalVendedores(supabase: SupabaseService,
       const posicionStr = posicion <= 3 ? medallas[posicion - 1] : `#${posicion}`;
 
       // Revenue total del equipo
-      let revenueEquipo = 0;
-      todosCierresSem?.forEach(c => revenueEquipo += c.properties?.price || 2000000);
+      const revenueEquipo = mSem.totals.revenue;
       const porcentajeEquipo = revenueEquipo > 0 ? Math.round((revenueVendedor / revenueEquipo) * 100) : 0;
 
       // Insights personalizados
@@ -1230,7 +1311,7 @@ export async function enviarEncuestasNPS(supabase: SupabaseService, meta: MetaWh
     const { data: cierres } = await supabase.client
       .from('leads')
       .select('*, team_members:assigned_to(id, name)')
-      .in('status', ['closed', 'delivered'])
+      .in('status', SALE_STATUSES)
       .gte('status_changed_at', hace8Dias.toISOString())
       .lte('status_changed_at', hace7Dias.toISOString());
 
@@ -1434,10 +1515,16 @@ export async function enviarReporteDiarioVendedores(supabase: SupabaseService, m
     const finAyer = new Date(finHoy);
     finAyer.setDate(finAyer.getDate() - 1);
 
-    // Datos globales (parallelized with Promise.all)
     const manana = new Date(inicioHoy);
     manana.setDate(manana.getDate() + 1);
 
+    // Conteos de hoy y ayer desde el rollup daily_metrics (null → queries crudas)
+    const dayHoy = toDayKey(inicioHoy);
+    const dayAyer = toDayKey(inicioAyer);
+    const rollup = await createDailyMetrics(supabase).getRange(dayAyer, dayHoy);
+    const skip = Promise.resolve({ data: null as any[] | null });
+
+    // Datos globales (parallelized with Promise.all)
     const [
       { data: todosLeadsHoy },
       { data: todosCierresHoy },
@@ -1448,19 +1535,20 @@ export async function enviarReporteDiarioVendedores(supabase: SupabaseService, m
       { data: pipelineActivo },
       { data: followupsHoy }
     ] = await Promise.all([
-      supabase.client.from('leads').select('*, properties(price)')
+      rollup ? skip : supabase.client.from('leads').select('*, properties(price)')
         .gte('created_at', inicioHoy.toISOString()).lte('created_at', finHoy.toISOString()),
-      supabase.client.from('leads').select('*, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('*, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioHoy.toISOString()).lte('status_changed_at', finHoy.toISOString()),
-      supabase.client.from('appointments').select('*')
+      // Citas de hoy por status (el rollup no distingue 'scheduled')
+      supabase.client.from('appointments').select('vendedor_id, status')
         .eq('scheduled_date', inicioHoy.toISOString().split('T')[0]),
       supabase.client.from('appointments').select('*, leads(name, phone)')
         .eq('scheduled_date', manana.toISOString().split('T')[0]).eq('status', 'scheduled'),
-      supabase.client.from('leads').select('id, assigned_to')
+      rollup ? skip : supabase.client.from('leads').select('id, assigned_to')
         .gte('created_at', inicioAyer.toISOString()).lte('created_at', finAyer.toISOString()),
-      supabase.client.from('leads').select('id, assigned_to, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('id, assigned_to, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioAyer.toISOString()).lte('status_changed_at', finAyer.toISOString()),
       supabase.client.from('leads').select('*, properties(price)')
         .in('status', ['new', 'contacted', 'qualified', 'negotiation', 'scheduled', 'visited']),
@@ -1468,12 +1556,17 @@ export async function enviarReporteDiarioVendedores(supabase: SupabaseService, m
         .gte('created_at', inicioHoy.toISOString()).lte('created_at', finHoy.toISOString())
     ]);
 
+    const mHoy = rollup
+      ? summarizeDailyMetrics(rollup, dayHoy, dayHoy)
+      : summarizeRawByVendedor(todosLeadsHoy, todosCierresHoy, []);
+    const mAyer = rollup
+      ? summarizeDailyMetrics(rollup, dayAyer, dayAyer)
+      : summarizeRawByVendedor(todosLeadsAyer, todosCierresAyer, []);
+
     // Calcular ranking del día por cierres
     const vendedoresConCierres = vendedores.map(v => {
-      const cierresV = todosCierresHoy?.filter(c => c.assigned_to === v.id) || [];
-      let revenueV = 0;
-      cierresV.forEach(c => revenueV += c.properties?.price || 2000000);
-      return { ...v, cierresCount: cierresV.length, revenueV };
+      const totalsV = mHoy.byVendedor[v.id];
+      return { ...v, cierresCount: totalsV?.sales || 0, revenueV: totalsV?.revenue || 0 };
     }).sort((a, b) => b.cierresCount - a.cierresCount || b.revenueV - a.revenueV);
 
     // Función para calcular variación
@@ -1498,25 +1591,20 @@ export async function enviarReporteDiarioVendedores(supabase: SupabaseService, m
         continue;
       }
 
-      // Datos individuales del vendedor - HOY
-      const leadsVendedorHoy = todosLeadsHoy?.filter(l => l.assigned_to === vendedor.id) || [];
-      const cierresVendedorHoy = todosCierresHoy?.filter(c => c.assigned_to === vendedor.id) || [];
+      // Datos individuales del vendedor - HOY y ayer
+      const hoyV = mHoy.byVendedor[vendedor.id] || emptyTotals();
+      const ayerV = mAyer.byVendedor[vendedor.id] || emptyTotals();
       const citasVendedorHoy = todasCitasHoy?.filter(c => c.vendedor_id === vendedor.id) || [];
       const citasVendedorManana = citasManana?.filter(c => c.vendedor_id === vendedor.id) || [];
       const pipelineVendedor = pipelineActivo?.filter(p => p.assigned_to === vendedor.id) || [];
 
-      // Datos de ayer
-      const leadsVendedorAyer = todosLeadsAyer?.filter(l => l.assigned_to === vendedor.id) || [];
-      const cierresVendedorAyer = todosCierresAyer?.filter(c => c.assigned_to === vendedor.id) || [];
-
       // Cálculos
-      const leadsHoyCount = leadsVendedorHoy.length;
-      const leadsAyerCount = leadsVendedorAyer.length;
-      const cierresHoyCount = cierresVendedorHoy.length;
-      const cierresAyerCount = cierresVendedorAyer.length;
+      const leadsHoyCount = hoyV.leads;
+      const leadsAyerCount = ayerV.leads;
+      const cierresHoyCount = hoyV.sales;
+      const cierresAyerCount = ayerV.sales;
 
-      let revenueHoy = 0;
-      cierresVendedorHoy.forEach(c => revenueHoy += c.properties?.price || 2000000);
+      const revenueHoy = hoyV.revenue;
 
       // Citas de hoy
       const citasHoyTotal = citasVendedorHoy.length;
@@ -1539,18 +1627,7 @@ export async function enviarReporteDiarioVendedores(supabase: SupabaseService, m
       const followupsPendientes = followupsVendedor.filter(f => f.status === 'pending').length;
 
       // Tiempo de respuesta hoy
-      let tiemposRespuesta: number[] = [];
-      for (const l of leadsVendedorHoy) {
-        if (l.first_response_at && l.created_at) {
-          const created = new Date(l.created_at).getTime();
-          const responded = new Date(l.first_response_at).getTime();
-          const diffMin = (responded - created) / 60000;
-          if (diffMin > 0 && diffMin < 1440) tiemposRespuesta.push(diffMin);
-        }
-      }
-      const tiempoPromedioMin = tiemposRespuesta.length > 0
-        ? Math.round(tiemposRespuesta.reduce((a, b) => a + b, 0) / tiemposRespuesta.length)
-        : 0;
+      const tiempoPromedioMin = Math.round(avgResponseMinutes(hoyV));
       const tiempoRespuestaStr = tiempoPromedioMin > 60
         ? `${Math.floor(tiempoPromedioMin/60)}h ${tiempoPromedioMin%60}m`
         : `${tiempoPromedioMin}min`;
@@ -1733,7 +1810,14 @@ export async function enviarReporteMensualVendedores(supabase: SupabaseService,
                    'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'];
     const nombreMes = meses[mesReporte];
 
-    // Datos globales del mes
+    // Conteos desde el rollup daily_metrics (mes reportado + anterior en un
+    // rango). Si no está disponible, rollup = null y se usan las queries crudas.
+    const dayMesAnterior = toDayKey(inicioMesAnterior);
+    const dayInicioMes = toDayKey(inicioMesReporte);
+    const dayFinMes = toDayKey(finMesReporte);
+    const rollup = await createDailyMetrics(supabase).getRange(dayMesAnterior, dayFinMes);
+    const skip = Promise.resolve({ data: null as any[] | null });
+
     // Datos globales del mes (parallelized with Promise.all)
     const [
       { data: todosLeadsMes },
@@ -1744,20 +1828,20 @@ export async function enviarReporteMensualVendedores(supabase: SupabaseService,
       { data: todasCitasMesAnt },
       { data: todasEncuestasMes }
     ] = await Promise.all([
-      supabase.client.from('leads').select('*, properties(price)')
+      rollup ? skip : supabase.client.from('leads').select('*, properties(price)')
         .gte('created_at', inicioMesReporte.toISOString()).lte('created_at', finMesReporte.toISOString()),
-      supabase.client.from('leads').select('*, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('*, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioMesReporte.toISOString()).lte('status_changed_at', finMesReporte.toISOString()),
-      supabase.client.from('appointments').select('*')
+      rollup ? skip : supabase.client.from('appointments').select('*')
         .gte('scheduled_date', inicioMesReporte.toISOString().split('T')[0])
         .lte('scheduled_date', finMesReporte.toISOString().split('T')[0]),
-      supabase.client.from('leads').select('id, assigned_to')
+      rollup ? skip : supabase.client.from('leads').select('id, assigned_to')
         .gte('created_at', inicioMesAnterior.toISOString()).lte('created_at', finMesAnterior.toISOString()),
-      supabase.client.from('leads').select('id, assigned_to, properties(price)')
-        .in('status', ['closed', 'delivered'])
+      rollup ? skip : supabase.client.from('leads').select('id, assigned_to, properties(price)')
+        .in('status', SALE_STATUSES)
         .gte('status_changed_at', inicioMesAnterior.toISOString()).lte('status_changed_at', finMesAnterior.toISOString()),
-      supabase.client.from('appointments').select('id, vendedor_id, status')
+      rollup ? skip : supabase.client.from('appointments').select('id, vendedor_id, status')
         .gte('scheduled_date', inicioMesAnterior.toISOString().split('T')[0])
         .lte('scheduled_date', finMesAnterior.toISOString().split('T')[0]),
       supabase.client.from('surveys').select('*')
@@ -1765,17 +1849,32 @@ export async function enviarReporteMensualVendedores(supabase: SupabaseService,
         .gte('answered_at', inicioMesReporte.toISOString()).lte('answered_at', finMesReporte.toISOString())
     ]);
 
+    const mMes = rollup
+      ? summarizeDailyMetrics(rollup, dayInicioMes, dayFinMes)
+      : summarizeRawByVendedor(todosLeadsMes, todosCierresMes, todasCitasMes);
+    const mMesAnt = rollup
+      ? summarizeDailyMetrics(rollup, dayMesAnterior, toDayKey(finMesAnterior))
+      : summarizeRawByVendedor(todosLeadsMesAnt, todosCierresMesAnt, todasCitasMesAnt);
+
+    // Cierres de un vendedor en un rango de días (para "mejor semana")
+    const cierresEnRango = (vendedorId: string, desde: Date, hasta: Date): number => {
+      if (rollup) {
+        return summarizeDailyMetrics(rollup, toDayKey(desde), toDayKey(hasta)).byVendedor[vendedorId]?.sales || 0;
+      }
+      return (todosCierresMes || []).filter(c => {
+        const fecha = new Date(c.status_changed_at);
+        return c.assigned_to === vendedorId && fecha >= desde && fecha <= hasta;
+      }).length;
+    };
+
     // Calcular ranking por revenue
     const vendedoresConRevenue = vendedores.map(v => {
-      const cierresV = todosCierresMes?.filter(c => c.assigned_to === v.id) || [];
-      let revenueV = 0;
-      cierresV.forEach(c => revenueV += c.properties?.price || 2000000);
-      return { ...v, cierresCount: cierresV.length, revenueV };
+      const totalsV = mMes.byVendedor[v.id];
+      return { ...v, cierresCount: totalsV?.sales || 0, revenueV: totalsV?.revenue || 0 };
     }).sort((a, b) => b.revenueV - a.revenueV);
 
     // Revenue total del equipo
-    let revenueEquipo = 0;
-    todosCierresMes?.forEach(c => revenueEquipo += c.properties?.price || 2000000);
+    const revenueEquipo = mMes.totals.revenue;
 
     const calcVar = (a: number, b: number) => {
       if (b === 0) return a > 0 ? '↑' : '→';
@@ -1788,33 +1887,24 @@ export async function enviarReporteMensualVendedores(supabase: SupabaseService,
     for (const vendedor of vendedores) {
       if (!vendedor.phone) continue;
 
-      // Datos del mes
-      const leadsVendedor = todosLeadsMes?.filter(l => l.assigned_to === vendedor.id) || [];
-      const cierresVendedor = todosCierresMes?.filter(c => c.assigned_to === vendedor.id) || [];
-      const citasVendedor = todasCitasMes?.filter(c => c.vendedor_id === vendedor.id) || [];
-
-      // Datos mes anterior
-      const leadsVendedorAnt = todosLeadsMesAnt?.filter(l => l.assigned_to === vendedor.id) || [];
-      const cierresVendedorAnt = todosCierresMesAnt?.filter(c => c.assigned_to === vendedor.id) || [];
-      const citasVendedorAnt = todasCitasMesAnt?.filter(c => c.vendedor_id === vendedor.id) || [];
+      // Datos del mes y mes anterior
+      const mesV = mMes.byVendedor[vendedor.id] || emptyTotals();
+      const mesAntV = mMesAnt.byVendedor[vendedor.id] || emptyTotals();
 
       // Cálculos
-      const leadsCount = leadsVendedor.length;
-      const leadsCountAnt = leadsVendedorAnt.length;
-      const cierresCount = cierresVendedor.length;
-      const cierresCountAnt = cierresVendedorAnt.length;
-
-      let revenueVendedor = 0;
-      cierresVendedor.forEach(c => revenueVendedor += c.properties?.price || 2000000);
+      const leadsCount = mesV.leads;
+      const leadsCountAnt = mesAntV.leads;
+      const cierresCount = mesV.sales;
+      const cierresCountAnt = mesAntV.sales;
 
-      let revenueVendedorAnt = 0;
-      cierresVendedorAnt.forEach(c => revenueVendedorAnt += c.properties?.price || 2000000);
+      const revenueVendedor = mesV.revenue;
+      const revenueVendedorAnt = mesAntV.revenue;
 
       // Citas
-      const citasTotal = citasVendedor.length;
-      const citasTotalAnt = citasVendedorAnt.length;
-      const citasCompletadas = citasVendedor.filter(c => c.status === 'completed').length;
-      const citasCompletadasAnt = citasVendedorAnt.filter(c => c.status === 'completed').length;
+      const citasTotal = mesV.appointments;
+      const citasTotalAnt = mesAntV.appointments;
+      const citasCompletadas = mesV.appointmentsCompleted;
+      const citasCompletadasAnt = mesAntV.appointmentsCompleted;
       const showRate = citasTotal > 0 ? Math.round((citasCompletadas / citasTotal) * 100) : 0;
       const showRateAnt = citasTotalAnt > 0 ? Math.round((citasCompletadasAnt / citasTotalAnt) * 100) : 0;
 
@@ -1826,18 +1916,7 @@ export async function enviarReporteMensualVendedores(supabase: SupabaseService,
       const ticketPromedio = cierresCount > 0 ? revenueVendedor / cierresCount : 0;
 
       // Tiempo de respuesta promedio
-      let tiemposRespuesta: number[] = [];
-      for (const l of leadsVendedor) {
-        if (l.first_response_at && l.created_at) {
-          const created = new Date(l.created_at).getTime();
-          const responded = new Date(l.first_response_at).getTime();
-          const diffMin = (responded - created) / 60000;
-          if (diffMin > 0 && diffMin < 1440) tiemposRespuesta.push(diffMin);
-        }
-      }
-      const tiempoPromedioMin = tiemposRespuesta.length > 0
-        ? Math.round(tiemposRespuesta.reduce((a, b) => a + b, 0) / tiemposRespuesta.length)
-        : 0;
+      const tiempoPromedioMin = Math.round(avgResponseMinutes(mesV));
       const tiempoRespuestaStr = tiempoPromedioMin > 60
         ? `${Math.floor(tiempoPromedioMin/60)}h ${tiempoPromedioMin%60}m`
         : `${tiempoPromedioMin}min`;
@@ -1861,10 +1940,7 @@ export async function enviarReporteMensualVendedores(supabase: SupabaseService,
         finSem.setDate(finSem.getDate() + 6);
         if (finSem > finMesReporte) finSem.setTime(finMesReporte.getTime());
 
-        const cierresSem = cierresVendedor.filter(c => {
-          const fecha = new Date(c.status_changed_at);
-          return fecha >= inicioSem && fecha <= finSem;
-        }).length;
+        const cierresSem = cierresEnRango(vendedor.id, inicioSem, finSem);
 
         if (cierresSem > mejorSemana) {
           mejorSemana = cierresSem;
@@ -2313,7 +2389,7 @@ export async function enviarReporteDiarioMarketing(supabase: SupabaseService, me
       supabase.client.from('leads').select('*, properties(price)').gte('created_at', inicioHoy.toISOString()).lte('created_at', finHoy.toISOString()),
       supabase.client.from('leads').select('id, source').gte('created_at', inicioAyer.toISOString()).lte('created_at', finAyer.toISOString()),
       supabase.client.from('appointments').select('*').eq('scheduled_date', inicioHoy.toISOString().split('T')[0]),
-      supabase.client.from('leads').select('*, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioHoy.toISOString()).lte('status_changed_at', finHoy.toISOString())
+      supabase.client.from('leads').select('*, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioHoy.toISOString()).lte('status_changed_at', finHoy.toISOString())
     ]);
 
     const calcVar = (a: number, b: number) => { if (b === 0) return a > 0 ? '↑' : '→'; if (a > b) return `↑${Math.round((a-b)/b*100)}%`; if (a < b) return `↓${Math.round((b-a)/b*100)}%`; return '→'; };
@@ -2399,8 +2475,8 @@ export async function enviarReporteSemanalMarketing(supabase: SupabaseService, m
       supabase.client.from('leads').select('*, properties(price)').gte('created_at', inicioSemana.toISOString()).lte('created_at', finSemana.toISOString()),
       supabase.client.from('leads').select('id, source').gte('created_at', inicioSemAnt.toISOString()).lte('created_at', finSemAnt.toISOString()),
       supabase.client.from('appointments').select('*').gte('scheduled_date', inicioSemana.toISOString().split('T')[0]).lte('scheduled_date', finSemana.toISOString().split('T')[0]),
-      supabase.client.from('leads').select('*, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioSemana.toISOString()).lte('status_changed_at', finSemana.toISOString()),
-      supabase.client.from('leads').select('id, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioSemAnt.toISOString()).lte('status_changed_at', finSemAnt.toISOString())
+      supabase.client.from('leads').select('*, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioSemana.toISOString()).lte('status_changed_at', finSemana.toISOString()),
+      supabase.client.from('leads').select('id, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioSemAnt.toISOString()).lte('status_changed_at', finSemAnt.toISOString())
     ]);
 
     const calcVar = (a: number, b: number) => { if (b === 0) return a > 0 ? '↑' : '→'; if (a > b) return `↑${Math.round((a-b)/b*100)}%`; if (a < b) return `↓${Math.round((b-a)/b*100)}%`; return '→'; };
@@ -2519,8 +2595,8 @@ export async function enviarReporteMensualMarketing(supabase: SupabaseService, m
       supabase.client.from('leads').select('*, properties(price)').gte('created_at', inicioMesReporte.toISOString()).lte('created_at', finMesReporte.toISOString()),
       supabase.client.from('leads').select('id, source').gte('created_at', inicioMesAnterior.toISOString()).lte('created_at', finMesAnterior.toISOString()),
       supabase.client.from('appointments').select('*').gte('scheduled_date', inicioMesReporte.toISOString().split('T')[0]).lte('scheduled_date', finMesReporte.toISOString().split('T')[0]),
-      supabase.client.from('leads').select('*, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioMesReporte.toISOString()).lte('status_changed_at', finMesReporte.toISOString()),
-      supabase.client.from('leads').select('id, properties(price)').in('status', ['closed', 'delivered']).gte('status_changed_at', inicioMesAnterior.toISOString()).lte('status_changed_at', finMesAnterior.toISOString())
+      supabase.client.from('leads').select('*, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioMesReporte.toISOString()).lte('status_changed_at', finMesReporte.toISOString()),
+      supabase.client.from('leads').select('id, properties(price)').in('status', SALE_STATUSES).gte('status_changed_at', inicioMesAnterior.toISOString()).lte('status_changed_at', finMesAnterior.toISOString())
     ]);
 
     const calcVar = (a: number, b: number) => { if (b === 0) return a > 0 ? '↑' : '→'; if (a > b) return `↑${Math.round((a-b)/b*100)}%`; if (a < b) return `↓${Math.round((b-a)/b*100)}%`; return '→'; };
@@ -2715,6 +2791,8 @@ export async function aplicarPreciosProgramados(supabase: SupabaseService, meta:
       }
     }
 
+    if (aplicados > 0) await getEntityCache(supabase, env?.SARA_CACHE).invalidate('properties');
+
     // Registrar en historial (si existe la tabla)
     try {
       await supabase.client
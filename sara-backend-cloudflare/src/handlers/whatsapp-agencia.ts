@@ -738,7 +738,7 @@ export async function enviarASegmento(ctx: HandlerContext, from: string, body: s
       resultado.filtroDescripcion,
       usuario.id,
       async (phone, mensaje) => {
-        await ctx.twilio.sendWhatsAppMessage(phone, mensaje);
+        return await ctx.twilio.sendWhatsAppMessage(phone, mensaje);
       },
       async (phone, templateName, lang, components) => {
         return await ctx.meta.sendTemplate(phone, templateName, lang, components);
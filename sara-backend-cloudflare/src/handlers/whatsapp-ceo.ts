@@ -8,6 +8,7 @@ import * as utils from './whatsapp-utils';
 import { deliverPendingMessage, findLeadByName, freshNotesUpdate } from './whatsapp-utils';
 import { isPendingExpired } from '../utils/teamMessaging';
 import { CEOCommandsService } from '../services/ceoCommandsService';
+import { getCacheService } from '../services/cacheService';
 import { AgenciaCommandsService } from '../services/agenciaCommandsService';
 import { safeJsonParse } from '../utils/safeHelpers';
 import { AsesorCommandsService } from '../services/asesorCommandsService';
@@ -525,7 +526,7 @@ export async function handleCEOMessage(ctx: HandlerContext, handler: any, from:
 // ═══════════════════════════════════════════════════════════════
 
 export async function executeCEOHandler(ctx: HandlerContext, handler: any, from: string, body: string, ceo: any, nombreCEO: string, teamMembers: any[], handlerName: string, params?: any): Promise<void> {
-    const ceoService = new CEOCommandsService(ctx.supabase);
+    const ceoService = new CEOCommandsService(ctx.supabase, ctx.env?.SARA_CACHE ? getCacheService(ctx.env.SARA_CACHE) : null);
     const cleanPhone = from.replace('whatsapp:', '').replace('+', '');
 
     // ━━━ PRIMERO: Intentar ejecutar via servicio centralizado ━━━
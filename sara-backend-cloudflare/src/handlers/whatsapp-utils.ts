@@ -7,6 +7,7 @@ import { HandlerContext } from './whatsapp-types';
 import { SupabaseService } from '../services/supabase';
 import { LeadManagementService } from '../services/leadManagementService';
 import { PropertyService } from '../services/propertyService';
+import { getEntityCache } from '../services/entityCache';
 import { MortgageService, MortgageData } from '../services/mortgageService';
 import { AppointmentService, CrearCitaParams, CrearCitaResult } from '../services/appointmentService';
 import { CalendarService } from '../services/calendar';
@@ -510,37 +511,8 @@ export function getBrochureUrl(desarrollo: string, modelo?: string): string {
 }
 
 export async function getAllProperties(ctx: HandlerContext): Promise<any[]> {
-  const CACHE_KEY = 'properties_all';
-  const CACHE_TTL = 600;
-
   try {
-    const kv = ctx.env?.SARA_CACHE;
-    if (kv) {
-      try {
-        const cached = await kv.get(CACHE_KEY, 'json');
-        if (cached) {
-          console.log('📦 Cache HIT: properties');
-          return cached as any[];
-        }
-        console.log('🔍 Cache MISS: properties - fetching from DB');
-      } catch (cacheErr) {
-        console.error('⚠️ Error leyendo cache properties:', cacheErr);
-      }
-    }
-
-    const propertyService = new PropertyService(ctx.supabase);
-    const data = await propertyService.getAllProperties();
-
-    if (kv && data?.length) {
-      try {
-        await kv.put(CACHE_KEY, JSON.stringify(data), { expirationTtl: CACHE_TTL });
-        console.log('💾 Cache SET: properties (TTL: 10min)');
-      } catch (cacheErr) {
-        console.error('⚠️ Error guardando properties en cache:', cacheErr);
-      }
-    }
-
-    return data;
+    return await getEntityCache(ctx.supabase, ctx.env?.SARA_CACHE).getProperties();
   } catch (e) {
     console.error('❌ Excepción en getAllProperties:', e);
     return [];
@@ -611,51 +583,22 @@ export function findTeamMemberByRole(teamMembers: any[], role: string, banco?: s
 }
 
 export async function getAllTeamMembers(ctx: HandlerContext): Promise<any[]> {
-  const CACHE_KEY = 'team_members_active';
-  const CACHE_TTL = 300;
-
   try {
-    const kv = ctx.env?.SARA_CACHE;
-    if (kv) {
-      try {
-        const cached = await kv.get(CACHE_KEY, 'json');
-        if (cached) {
-          console.log('📦 Cache HIT: team_members');
-          return cached as any[];
-        }
-        console.log('🔍 Cache MISS: team_members - fetching from DB');
-      } catch (cacheErr) {
-        console.error('⚠️ Error leyendo cache:', cacheErr);
-      }
-    }
-
-    const { data, error } = await ctx.supabase.client
-      .from('team_members')
-      .select("*")
-      .eq('active', true);
-
-    if (error) {
-      console.error('❌ Error cargando team_members:', error);
+    let data: any[];
+    try {
+      data = await getEntityCache(ctx.supabase, ctx.env?.SARA_CACHE).getTeamMembers();
+    } catch (err) {
+      console.error('❌ Error cargando team_members:', err);
       const { data: fallback } = await ctx.supabase.client
         .from('team_members')
         .select("*");
       console.error('⚠️ Usando fallback sin filtro active:', fallback?.length || 0, 'miembros');
       return fallback || [];
     }
+    console.log(`👥 Team members: ${data.length} activos`);
 
-    console.log(`👥 Team members cargados: ${data?.length || 0} activos`);
-
-    if (kv && data) {
-      try {
-        await kv.put(CACHE_KEY, JSON.stringify(data), { expirationTtl: CACHE_TTL });
-        console.log('💾 Cache SET: team_members (TTL: 5min)');
-      } catch (cacheErr) {
-        console.error('⚠️ Error guardando en cache:', cacheErr);
-      }
-    }
-
-    const vendedores = (data || []).filter((m: any) => m.role?.toLowerCase().includes('vendedor'));
-    const asesores = (data || []).filter((m: any) =>
+    const vendedores = data.filter((m: any) => m.role?.toLowerCase().includes('vendedor'));
+    const asesores = data.filter((m: any) =>
       m.role?.toLowerCase().includes('asesor') ||
       m.role?.toLowerCase().includes('hipotec') ||
       m.role?.toLowerCase().includes('credito')
@@ -668,7 +611,7 @@ export async function getAllTeamMembers(ctx: HandlerContext): Promise<any[]> {
       console.warn('⚠️ ALERTA: No hay asesores de crédito activos en el sistema');
     }
 
-    return data || [];
+    return data;
   } catch (e) {
     console.error('❌ Excepción en getAllTeamMembers:', e);
     return [];
@@ -1,4 +1,5 @@
 import { HandlerContext } from './whatsapp-types';
+import { getEntityCache } from '../services/entityCache';
 import { VendorCommandsService, sanitizeNotes } from '../services/vendorCommandsService';
 import { AppointmentSchedulingService } from '../services/appointmentSchedulingService';
 import { MortgageService } from '../services/mortgageService';
@@ -6041,6 +6042,7 @@ export async function vendedorOnOff(ctx: HandlerContext, handler: any, from: str
       .from('team_members')
       .update({ is_on_duty: estado })
       .eq('id', vendedor.id);
+    await getEntityCache(ctx.supabase, ctx.env?.SARA_CACHE).invalidate('team');
 
     if (estado) {
       await ctx.twilio.sendWhatsAppMessage(from, `✅ *Disponibilidad activada*\n\n${nombre}, ahora recibirás nuevos leads y notificaciones.\n\n💡 Escribe *OFF* para pausar.`);
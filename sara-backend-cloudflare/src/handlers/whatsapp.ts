@@ -19,6 +19,7 @@ import { enviarAlertaSistema, logErrorToDB } from '../crons/healthCheck';
 import { TenantContext, getDefaultTenant } from '../middleware/tenant';
 import { isLikelySurveyResponse } from '../crons/nurturing';
 import { createSLAMonitoring } from '../services/slaMonitoringService';
+import { recordConversationIntents } from '../services/conversationIntentService';
 
 // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 // MÓDULOS REFACTORIZADOS
@@ -101,7 +102,8 @@ export class WhatsAppHandler {
     private twilio: TwilioService,
     private calendar: any,
     private meta: MetaWhatsAppService,
-    tenant?: TenantContext
+    tenant?: TenantContext,
+    private waitUntil?: (promise: Promise<any>) => void // ctx.waitUntil del request
   ) {
     this.tenant = tenant || getDefaultTenant();
   }
@@ -1042,6 +1044,16 @@ export class WhatsAppHandler {
         }
       }
 
+      // ═══ INTENT COUNTERS: clasificar al recibir (para /api/metrics/conversation) ═══
+      // Fuera del hot path: corre en waitUntil; sin ctx (tests/rutas de prueba) se espera
+      const intentCounters = recordConversationIntents(this.supabase, body)
+        .catch(e => console.error('⚠️ Intent counters error (non-blocking):', e));
+      if (this.waitUntil) {
+        this.waitUntil(intentCounters);
+      } else {
+        await intentCounters;
+      }
+
       // ═══ PRIMERO: DETECTAR SI LEAD QUIERE CONTACTAR ASESOR/VENDEDOR ═══
       const quiereContacto = msgLower.includes('hablar con') ||
         msgLower.includes('contactar') ||
@@ -1,6 +1,6 @@
-import { SupabaseService } from './services/supabase';
+import { SupabaseService, setTenantJwtSecret } from './services/supabase';
 import { ClaudeService } from './services/claude';
-import { CacheService } from './services/cacheService';
+import { CacheService, getCacheService } from './services/cacheService';
 
 import { MetaWhatsAppService } from './services/meta-whatsapp';
 import { CalendarService } from './services/calendar';
@@ -8,8 +8,7 @@ import { WhatsAppHandler } from './handlers/whatsapp';
 import { formatPhoneForDisplay } from './handlers/whatsapp-utils';
 import { handleTeamRoutes } from './routes/team-routes';
 import { handlePromotionRoutes } from './routes/promotions';
-import { handleRetellRoutes } from './routes/retell';
-import { handleTestRoutes } from './routes/test';
+import { handleOpsRoutes } from './routes/ops';
 import { handleApiCoreRoutes } from './routes/api-core';
 import { handleApiBiRoutes } from './routes/api-bi';
 import { handleApiTasksRoutes } from './routes/api-tasks';
@@ -29,17 +28,22 @@ import { AIConversationService } from './services/aiConversationService';
 import { LocationService } from './services/locationService';
 import { getAvailableVendor, TeamMemberAvailability } from './services/leadManagementService';
 import { createTTSTrackingService } from './services/ttsTrackingService';
-import { createMessageTrackingService } from './services/messageTrackingService';
 import { safeJsonParse } from './utils/safeHelpers';
-import { createMetaWithTracking } from './utils/metaTracking';
-import { processRetryQueue, enqueueFailedMessage } from './services/retryQueueService';
+import { createMetaWithTracking, createRequestTrackingBuffer } from './utils/metaTracking';
+import { createCampaignCounterBuffer, CampaignCounterBuffer } from './services/campaignCounterService';
+import { createDeliveryStatusBuffer, sendWindowClosedFallback, DeliveryStatusRow } from './services/deliveryStatusService';
+import { processRetryQueue, enqueueFailedMessage, enqueueFailedMessages } from './services/retryQueueService';
+import { MessageQueueService } from './services/messageQueueService';
 import { createLeadAttribution } from './services/leadAttributionService';
 import { createSLAMonitoring } from './services/slaMonitoringService';
 import { createLeadDeduplication } from './services/leadDeduplicationService';
 import { CronTracker, getObservabilityDashboard, formatObservabilityForWhatsApp } from './services/observabilityService';
+import { SubrequestGovernor, CronTaskBudgetOptions } from './services/subrequestGovernor';
 import { resolveTenantFromWebhook, resolveTenantFromRequest, resolveTenantsForCron, getDefaultTenant } from './middleware/tenant';
+import { getJWTSecret } from './middleware/auth';
 import { handleAuthRoutes } from './routes/auth';
-import { MonthlyEmailReportService } from './services/monthlyEmailReportService';
+import { RequestServices } from './services/ServiceFactory';
+import { getEntityCache, reportEntityCache } from './services/entityCache';
 
 // CRON modules
 import {
@@ -196,6 +200,9 @@ import {
 
 // Dashboard - backup (status/analytics moved to routes/api-bi.ts)
 import { exportBackup, backupSemanalR2, getBackupLog } from './crons/dashboard';
+import { createIncrementalBackup } from './services/incrementalBackupService';
+import { precomputeForecast } from './services/forecastingService';
+import { runScheduledReports } from './services/reportBuilderService';
 
 // Health Check - Automated monitoring and alerts
 import {
@@ -225,2320 +232,2156 @@ import {
   log,
   checkRateLimit,
   checkApiAuth,
+  hasValidApiKey,
   requiresAuth,
   verifyMetaSignature,
   checkPendingSurveyResponse,
 } from './utils/middleware';
+import { compileRoutes, routePolicy, RATE_LIMIT_CLASSES } from './utils/router';
+import {
+  createInboundQueue,
+  splitMetaWebhook,
+  toWebhookBody,
+  consumeInboundEvents,
+  recordIngestLatency,
+  InboundEvent
+} from './services/inboundQueueService';
+import type { RouteDef, RouteHandler, RouteAuth, RateLimitClass } from './utils/router';
 
 // Inline utility functions moved to src/utils/middleware.ts
 // (corsResponse, checkRateLimit, checkApiAuth, requiresAuth, verifyMetaSignature, etc.)
 
-export default {
-  async fetch(request: Request, env: Env, ctx: ExecutionContext): Promise<Response> {
-    const url = new URL(request.url);
-    const requestId = generateRequestId();
-
-    // Inicializar Sentry para error tracking
-    const sentry = initSentry(request, env, ctx);
-    sentry.setTag('request_id', requestId);
-    sentry.setTag('path', url.pathname);
-    sentry.addBreadcrumb({
-      message: `${request.method} ${url.pathname}`,
-      category: 'http',
-      level: 'info',
-      data: { method: request.method, path: url.pathname }
-    });
-
-    // Log incoming request
-    log('info', `${request.method} ${url.pathname}`, requestId, {
-      method: request.method,
-      path: url.pathname,
-      ip: request.headers.get('CF-Connecting-IP') || 'unknown'
-    });
-
-    if (request.method === 'OPTIONS') {
-      return corsResponse(null, 204, 'application/json', request);
-    }
-
-    try {
-
-    // ═══════════════════════════════════════════════════════════
-    // RATE LIMITING: per-endpoint limits (req/min per IP)
-    // ═══════════════════════════════════════════════════════════
-    const pathname = url.pathname;
-    let rateLimitMax = 100; // default: 100/min
-    let rateLimitFailClosed = false; // default: fail open for CRM traffic
-    if (pathname === '/test-ai-response') {
-      rateLimitMax = 10; // expensive Claude API call
-      rateLimitFailClosed = true;
-    } else if (pathname === '/test-load-test') {
-      rateLimitMax = 5; // very expensive: simulates N concurrent leads
-      rateLimitFailClosed = true;
-    } else if (pathname.startsWith('/run-')) {
-      rateLimitMax = 10; // CRON triggers: run-nps, run-backup, etc.
-      rateLimitFailClosed = true;
-    } else if (pathname === '/test-lead') {
-      rateLimitMax = 20; // sends real WhatsApp messages
-      rateLimitFailClosed = true;
-    }
-    const rateLimitError = await checkRateLimit(request, env, requestId, rateLimitMax, rateLimitFailClosed);
-    if (rateLimitError) return rateLimitError;
-
-    // ═══════════════════════════════════════════════════════════
-    // SEGURIDAD: Verificar autenticación para rutas protegidas
-    // ═══════════════════════════════════════════════════════════
-    if (requiresAuth(url.pathname)) {
-      const authError = checkApiAuth(request, env);
-      if (authError) return authError;
-    }
-
-    const supabase = new SupabaseService(env.SUPABASE_URL, env.SUPABASE_ANON_KEY);
-
-    // Resolve tenant for API requests (via X-Tenant-ID header or default Santa Rita)
-    if (url.pathname.startsWith('/api/')) {
-      const apiTenant = await resolveTenantFromRequest(request, supabase);
-      await supabase.setTenant(apiTenant.tenantId);
-    }
-
-    const cache = new CacheService(env.SARA_CACHE);
-    // ═══════════════════════════════════════════════════════════
-    // API Routes - Team Members
-    // ═══════════════════════════════════════════════════════════
-    // ═══════════════════════════════════════════════════════════
-    // AUTH ROUTES (no auth required — handles its own auth)
-    // ═══════════════════════════════════════════════════════════
-    if (url.pathname.startsWith('/api/auth/')) {
-      const authResp = await handleAuthRoutes(url, request, env, supabase, corsResponse);
-      if (authResp) return authResp;
-    }
-
-    if (url.pathname.startsWith('/api/team-members') || url.pathname.startsWith('/api/admin/')) {
-      const response = await handleTeamRoutes(request, env, supabase);
-      if (response) return response;
+// ═══════════════════════════════════════════════════════════════════════════
+// ROUTE TABLE — compilada una vez por isolate (src/utils/router.ts)
+// Orden = orden de despacho. /webhook/meta va primero: es el tráfico más
+// caliente y antes recorría toda la cadena de módulos. Los módulos con su
+// propia cadena interna se montan por los prefijos que atienden; las rutas
+// exactas con rate limit propio se declaran para que su clase aplique.
+// ═══════════════════════════════════════════════════════════════════════════
+interface RouteContext {
+  url: URL;
+  request: Request;
+  env: Env;
+  ctx: ExecutionContext;
+  requestId: string;
+  services: RequestServices;
+  supabase: SupabaseService;  // getter: se construye al primer acceso
+  cache: CacheService;        // getter: se construye al primer acceso
+}
+
+const authRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase }) =>
+  handleAuthRoutes(url, request, env, supabase, corsResponse);
+const teamRoutes: RouteHandler<RouteContext> = ({ request, env, supabase }) =>
+  handleTeamRoutes(request, env, supabase);
+const promotionRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase }) =>
+  handlePromotionRoutes(request, url, supabase, new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN));
+// routes/retell.ts (3k líneas) se evalúa la primera vez que llega una ruta de Retell
+const retellRoutes: RouteHandler<RouteContext> = async ({ url, request, env, supabase }) => {
+  const { handleRetellRoutes } = await import('./routes/retell');
+  return handleRetellRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
+};
+const opsRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase, cache }) =>
+  handleOpsRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any, cache);
+
+// Rutas test/debug (routes/test.ts, routes/debug.ts): __DEBUG_ROUTES__ se
+// reemplaza en build ([define] de wrangler.toml). En producción es false,
+// esbuild elimina estas ramas y los import() nunca llegan al bundle; en
+// staging los módulos se cargan la primera vez que se pide una ruta.
+const testRoutes: RouteHandler<RouteContext> = async ({ url, request, env, supabase, cache }) => {
+  if (__DEBUG_ROUTES__) {
+    const { handleTestRoutes } = await import('./routes/test');
+    return handleTestRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any, cache);
+  }
+  return null;
+};
+const debugRoutes: RouteHandler<RouteContext> = async ({ url, request, env, supabase }) => {
+  if (__DEBUG_ROUTES__) {
+    const { handleDebugRoutes } = await import('./routes/debug');
+    return handleDebugRoutes(url, request, env, supabase, corsResponse);
+  }
+  return null;
+};
+const apiCoreRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase }) =>
+  handleApiCoreRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
+const apiBiRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase, cache }) =>
+  handleApiBiRoutes(url, request, env, supabase, cache, corsResponse, checkApiAuth as any);
+const apiTasksRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase }) =>
+  handleApiTasksRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
+const apiCommsRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase }) =>
+  handleApiCommunicationsRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
+const apiReportsRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase, cache }) =>
+  handleApiReportsProRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any, cache);
+const apiSaasRoutes: RouteHandler<RouteContext> = ({ url, request, env, supabase }) =>
+  handleApiSaasRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
+
+/** Monta un módulo en varios paths con la misma auth/rate-limit */
+function mount(
+  name: string,
+  handler: RouteHandler<RouteContext>,
+  paths: string[],
+  auth: RouteAuth = 'path',
+  rateLimit: RateLimitClass = 'default'
+): RouteDef<RouteContext>[] {
+  return paths.map(path => ({ name, path, auth, rateLimit, handler }));
+}
+
+const ROUTES: RouteDef<RouteContext>[] = [
+  // Webhooks (públicos, validan su propia firma/token)
+  { name: 'meta_verify', method: 'GET', path: '/webhook/meta', auth: 'public', rateLimit: 'default', handler: handleMetaWebhookVerify },
+  { name: 'meta_webhook', method: 'POST', path: '/webhook/meta', auth: 'public', rateLimit: 'default', handler: handleMetaWebhook },
+
+  // Auth, equipo y promociones
+  ...mount('auth', authRoutes, ['/api/auth/*']),
+  ...mount('team', teamRoutes, ['/api/team-members*', '/api/admin/*']),
+  ...mount('promotions', promotionRoutes, ['/api/promotions*']),
+
+  // Retell (src/routes/retell.ts)
+  ...mount('retell', retellRoutes, ['/webhook/retell*'], 'public'),
+  ...mount('retell', retellRoutes, ['/api/retell-motivos*', '/configure-retell-*', '/debug-retell', '/retell-voices']),
+
+  // Test/debug (src/routes/test.ts) — solo builds con __DEBUG_ROUTES__; rutas caras primero para su rate limit
+  ...(__DEBUG_ROUTES__ ? [
+    ...mount('test', testRoutes, ['/test-ai-response'], 'api_key', 'ai'),
+    ...mount('test', testRoutes, ['/test-lead'], 'api_key', 'messaging'),
+    ...mount('test', testRoutes, ['/test-*', '/debug-*', '/api/test-*'], 'api_key'),
+  ] : []),
+
+  // Operación (src/routes/ops.ts): health, CRONs manuales, backups, asesor
+  ...mount('ops', opsRoutes, ['/run-*'], 'path', 'cron'),
+  ...mount('ops', opsRoutes, ['/', '/health'], 'public'),
+  ...mount('ops', opsRoutes, [
+    '/activate-team', '/api/asesor*', '/api/broadcasts-enable', '/api/cancel-appointment', '/api/emergency-stop',
+    '/api/followup-*', '/api/send-surveys', '/api/surveys', '/api/system-*', '/api/validate',
+    '/check-*', '/checklist', '/cleanup-test-leads', '/crear-*', '/create-*', '/delete-all-leads',
+    '/fix-cita-calendar', '/force-send-videos', '/limpiar-*', '/list-leads', '/logs', '/onboarding-equipo',
+    '/pending-surveys', '/reset-lead-resources', '/restore-backup', '/retell-*', '/send-*', '/set-*',
+    '/surveys', '/test-flujo-postvisita', '/update-property', '/verificar-pending-llamadas'
+  ]),
+
+  // API core (src/routes/api-core.ts)
+  ...mount('api_core', apiCoreRoutes, [
+    '/api/appointments*', '/api/diagnostico', '/api/error-logs*', '/api/events*', '/api/leads*',
+    '/api/mortgage_applications*', '/api/mortgages*', '/api/properties*', '/api/recalculate-scores',
+    '/api/test-*', '/brochure*'
+  ]),
+
+  // API BI (src/routes/api-bi.ts)
+  ...mount('api_bi', apiBiRoutes, ['/status', '/analytics'], 'public'),
+  ...mount('api_bi', apiBiRoutes, ['/test-*'], 'api_key'),
+  ...mount('api_bi', apiBiRoutes, [
+    '/admin*', '/api/alerts*', '/api/assignment*', '/api/attribution*', '/api/audit', '/api/business-hours',
+    '/api/cache', '/api/calendar*', '/api/clv*', '/api/compare*', '/api/create-*', '/api/dashboard*',
+    '/api/development-funnel', '/api/docs', '/api/financing*', '/api/flags', '/api/market*',
+    '/api/message-audit', '/api/message-metrics', '/api/metrics*', '/api/observability', '/api/offers*',
+    '/api/openapi.json', '/api/pipeline*', '/api/probability*', '/api/referrals*', '/api/reportes*',
+    '/api/reports*', '/api/send-template', '/api/sentiment*', '/api/sla*', '/api/team*', '/api/templates*',
+    '/api/tracking*', '/api/tts-metrics', '/api/visits*', '/api/webhooks*',
+    '/audit', '/backup', '/business-hours', '/cache', '/check-*', '/cotizacion*', '/docs*', '/flags',
+    '/heygen-*', '/message-status', '/metrics', '/openapi.json', '/pending-videos', '/quality',
+    '/regenerate-video*', '/report-preview', '/resend-video*', '/reset-video*', '/retry-video*', '/send-*', '/t/*'
+  ]),
+
+  // Fases 3-6 (tasks, comunicaciones, reportes pro, SaaS)
+  ...mount('api_tasks', apiTasksRoutes, [
+    '/api/custom-fields*', '/api/entities*', '/api/leads*', '/api/notes*', '/api/tags*', '/api/tasks*', '/api/team-members*'
+  ]),
+  ...mount('api_communications', apiCommsRoutes, ['/api/communications*', '/api/email*', '/api/leads*', '/api/sms*']),
+  ...mount('api_reports_pro', apiReportsRoutes, ['/api/reports*']),
+  ...mount('api_saas', apiSaasRoutes, [
+    '/api/admin*', '/api/billing*', '/api/invitations*', '/api/onboarding*', '/api/plans*', '/api/signup', '/api/usage*'
+  ]),
+
+  // Webhooks Facebook Lead Ads y Google Calendar
+  { name: 'facebook_leads_verify', method: 'GET', path: '/webhook/facebook-leads', auth: 'public', rateLimit: 'default', handler: handleFacebookLeadsVerify },
+  { name: 'facebook_leads', method: 'POST', path: '/webhook/facebook-leads', auth: 'public', rateLimit: 'default', handler: handleFacebookLeadsWebhook },
+  { name: 'google_calendar', method: 'POST', path: '/webhook/google-calendar', auth: 'public', rateLimit: 'default', handler: handleGoogleCalendarWebhook },
+
+  // Utilidades inline
+  { name: 'ab_results', path: '/ab-results', auth: 'path', rateLimit: 'default', handler: handleABResults },
+  { name: 'cron_status', path: '/cron-status', auth: 'path', rateLimit: 'default', handler: handleCronStatus },
+
+  // E2E de resiliencia y load test (src/routes/debug.ts). Sin method: el límite
+  // de 5 req/min aplica a cualquier método; el handler solo atiende POST
+  ...(__DEBUG_ROUTES__ ? [
+    { name: 'resilience_e2e', path: '/test-resilience-e2e', auth: 'api_key', rateLimit: 'default', handler: debugRoutes },
+    { name: 'load_test', path: '/test-load-test', auth: 'api_key', rateLimit: 'load_test', handler: debugRoutes },
+  ] as RouteDef<RouteContext>[] : []),
+];
+
+const router = compileRoutes(ROUTES);
+
+
+// ═══════════════════════════════════════════════════════════════
+// Webhook WhatsApp (Meta) - verificación GET
+// ═══════════════════════════════════════════════════════════════
+async function handleMetaWebhookVerify({ url }: RouteContext): Promise<Response | null> {
+  const mode = url.searchParams.get('hub.mode');
+  const token = url.searchParams.get('hub.verify_token');
+  const challenge = url.searchParams.get('hub.challenge');
+
+  if (mode === 'subscribe' && token === 'sara_verify_token') {
+    return new Response(challenge, { status: 200 });
+  }
+  return new Response('Forbidden', { status: 403 });
+}
+
+// ═══════════════════════════════════════════════════════════════
+// Webhook WhatsApp (Meta) - mensajes y estados
+// ═══════════════════════════════════════════════════════════════
+async function handleMetaWebhook({ request, env, ctx, supabase }: RouteContext): Promise<Response | null> {
+  const receivedAt = Date.now();
+  try {
+    console.log('📥 WEBHOOK META: Recibiendo mensaje...');
+
+    // Leer body como texto para verificar firma
+    const bodyText = await request.text();
+
+    // Verificar firma si META_WEBHOOK_SECRET está configurado
+    if (env.META_WEBHOOK_SECRET) {
+      const isValid = await verifyMetaSignature(request, bodyText, env.META_WEBHOOK_SECRET);
+      if (!isValid) {
+        console.error('🚫 WEBHOOK META: Firma inválida - posible spoofing');
+        return new Response('Invalid signature', { status: 401 });
+      }
+      console.log('✅ WEBHOOK META: Firma verificada');
+    } else {
+      console.warn('⚠️ META_WEBHOOK_SECRET no configurado - webhooks sin verificar');
     }
 
-
-    // API Routes - Promotions
-    if (url.pathname.startsWith("/api/promotions")) {
-      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
-      const response = await handlePromotionRoutes(request, url, supabase, meta);
-      if (response) return response;
+    const body = safeJsonParse(bodyText, null);
+    if (!body) {
+      console.error('❌ WEBHOOK META: JSON inválido, bodyText:', bodyText?.substring(0, 200));
+      return new Response('OK', { status: 200 });
     }
 
-    // ═══════════════════════════════════════════════════════════════
-    // RETELL ROUTES (extracted to src/routes/retell.ts)
-    // ═══════════════════════════════════════════════════════════════
-    const retellResp = await handleRetellRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
-    if (retellResp) return retellResp;
-
-    // ═══════════════════════════════════════════════════════════════
-    // TEST/DEBUG ROUTES (extracted to src/routes/test.ts)
-    // ═══════════════════════════════════════════════════════════════
-    const testResp = await handleTestRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any, cache);
-    if (testResp) return testResp;
-
-    // ═══════════════════════════════════════════════════════════════
-    // API CORE ROUTES (extracted to src/routes/api-core.ts)
-    // ═══════════════════════════════════════════════════════════════
-    const apiCoreResp = await handleApiCoreRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
-    if (apiCoreResp) return apiCoreResp;
-
-    // ═══════════════════════════════════════════════════════════════
-    // API BI ROUTES (extracted to src/routes/api-bi.ts)
-    // ═══════════════════════════════════════════════════════════════
-    const apiBiResp = await handleApiBiRoutes(url, request, env, supabase, cache, corsResponse, checkApiAuth as any);
-    if (apiBiResp) return apiBiResp;
-
-    // ═══════════════════════════════════════════════════════════════
-    // API TASKS ROUTES (Phase 3: tasks, tags, notes, custom fields, import/export)
-    // ═══════════════════════════════════════════════════════════════
-    const apiTasksResp = await handleApiTasksRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
-    if (apiTasksResp) return apiTasksResp;
-
-    // ═══════════════════════════════════════════════════════════════
-    // API COMMUNICATIONS ROUTES (Phase 4: email, SMS, timeline)
-    // ═══════════════════════════════════════════════════════════════
-    const apiCommsResp = await handleApiCommunicationsRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
-    if (apiCommsResp) return apiCommsResp;
-
-    // ═══════════════════════════════════════════════════════════════
-    // API REPORTS PRO ROUTES (Phase 5: reports, forecast, scorecard)
-    // ═══════════════════════════════════════════════════════════════
-    const apiReportsResp = await handleApiReportsProRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
-    if (apiReportsResp) return apiReportsResp;
-
-    // ═══════════════════════════════════════════════════════════════
-    // API SAAS ROUTES (Phase 6: signup, onboarding, billing, admin)
-    // ═══════════════════════════════════════════════════════════════
-    const apiSaasResp = await handleApiSaasRoutes(url, request, env, supabase, corsResponse, checkApiAuth as any);
-    if (apiSaasResp) return apiSaasResp;
-
-    // Webhook WhatsApp (Meta)
-    // ═══════════════════════════════════════════════════════════
-    if (url.pathname === '/webhook/meta' && request.method === 'GET') {
-      const mode = url.searchParams.get('hub.mode');
-      const token = url.searchParams.get('hub.verify_token');
-      const challenge = url.searchParams.get('hub.challenge');
-      
-      if (mode === 'subscribe' && token === 'sara_verify_token') {
-        return new Response(challenge, { status: 200 });
+    // ═══ ACK-FIRST: encolar los eventos y responder 200 sin procesar ═══
+    const inbound = createInboundQueue(env, metaInboundConsumer(env, ctx), (p) => ctx.waitUntil(p));
+    if (inbound) {
+      try {
+        await inbound.send(splitMetaWebhook(body, receivedAt));
+        recordIngestLatency('ack', Date.now() - receivedAt);
+        return new Response('OK', { status: 200 });
+      } catch (queueErr) {
+        console.error('⚠️ Inbound queue send failed, procesando en línea:', queueErr);
       }
-      return new Response('Forbidden', { status: 403 });
     }
 
-    if (url.pathname === '/webhook/meta' && request.method === 'POST') {
-      let from: string | undefined;
-      let messageId: string | undefined;
-      let kvDedupKey: string | null = null;
-      try {
-        console.log('📥 WEBHOOK META: Recibiendo mensaje...');
-
-        // Leer body como texto para verificar firma
-        const bodyText = await request.text();
-
-        // Verificar firma si META_WEBHOOK_SECRET está configurado
-        if (env.META_WEBHOOK_SECRET) {
-          const isValid = await verifyMetaSignature(request, bodyText, env.META_WEBHOOK_SECRET);
-          if (!isValid) {
-            console.error('🚫 WEBHOOK META: Firma inválida - posible spoofing');
-            return new Response('Invalid signature', { status: 401 });
-          }
-          console.log('✅ WEBHOOK META: Firma verificada');
-        } else {
-          console.warn('⚠️ META_WEBHOOK_SECRET no configurado - webhooks sin verificar');
-        }
-
-        const body = safeJsonParse(bodyText, null);
-        if (!body) {
-          console.error('❌ WEBHOOK META: JSON inválido, bodyText:', bodyText?.substring(0, 200));
-          return new Response('OK', { status: 200 });
-        }
-        console.log('📥 Body recibido:', JSON.stringify(body).substring(0, 500));
-
-        const entry = body?.entry?.[0];
-        const changes = entry?.changes?.[0];
-        const value = changes?.value;
-        const messages = value?.messages;
-        const statuses = value?.statuses;
-
-        // ═══════════════════════════════════════════════════════════
-        // TRACKING DE ESTADOS DE ENTREGA (sent, delivered, read, failed)
-        // ═══════════════════════════════════════════════════════════
-        if (statuses && statuses.length > 0) {
-          for (const status of statuses) {
-            const messageId = status.id;
-            const statusType = status.status; // sent, delivered, read, failed
-
-            // KV dedup — same message+status combo only processed once
-            try {
-              const statusDedupKey = `wast:${messageId}:${statusType}`;
-              if (await env.SARA_CACHE.get(statusDedupKey)) {
-                console.log(`⏭️ Status ya procesado: ${statusType} ${messageId?.substring(0, 20)}...`);
-                continue;
-              }
-              await env.SARA_CACHE.put(statusDedupKey, '1', { expirationTtl: 86400 });
-            } catch (_kvErr) { /* fallback: DB upsert is idempotent */ }
-            const recipientId = status.recipient_id;
-            const timestamp = status.timestamp;
-            const errorCode = status.errors?.[0]?.code;
-            const errorTitle = status.errors?.[0]?.title;
-
-            console.log(`📬 STATUS UPDATE: ${statusType} | To: ${recipientId} | MsgID: ${messageId?.substring(0, 30)}...`);
-
-            // Guardar en tabla message_delivery_status
-            try {
-              await supabase.client.from('message_delivery_status').upsert({
-                message_id: messageId,
-                recipient_phone: recipientId,
-                status: statusType,
-                timestamp: new Date(parseInt(timestamp) * 1000).toISOString(),
-                error_code: errorCode,
-                error_message: errorTitle,
-                updated_at: new Date().toISOString()
-              }, { onConflict: 'message_id' });
-
-              // Log especial para errores + encolar en retry_queue
-              if (statusType === 'failed') {
-                console.error(`❌ MENSAJE FALLIDO: ${recipientId} - Error ${errorCode}: ${errorTitle}`);
-
-                // ── 131047 = ventana 24h cerrada → enviar template fallback ──
-                if (errorCode === 131047 || String(errorCode) === '131047') {
-                  console.log(`📱 131047 detectado para ${recipientId}, enviando template fallback...`);
-                  try {
-                    // Buscar contenido original en messages_sent
-                    const { data: msgRow } = await supabase.client
-                      .from('messages_sent')
-                      .select('contenido, recipient_type, recipient_id')
-                      .eq('message_id', messageId)
-                      .single();
-
-                    const phoneSuffix = recipientId?.slice(-10) || '';
-
-                    // Determinar si es team member o lead
-                    const { data: tmMatch } = await supabase.client
-                      .from('team_members')
-                      .select('id, name, notes')
-                      .like('phone', `%${phoneSuffix}`)
-                      .eq('active', true)
-                      .limit(1);
-
-                    if (tmMatch && tmMatch.length > 0) {
-                      // ── TEAM MEMBER → resumen_vendedor + pending ──
-                      const tm = tmMatch[0];
-                      const nombreCorto = tm.name?.split(' ')[0] || 'Equipo';
-                      await meta.sendTemplate(recipientId, 'resumen_vendedor', 'es_MX', [{
-                        type: 'body',
-                        parameters: [
-                          { type: 'text', text: nombreCorto },
-                          { type: 'text', text: '-' },
-                          { type: 'text', text: '-' },
-                          { type: 'text', text: '-' },
-                          { type: 'text', text: '-' },
-                          { type: 'text', text: 'Responde para ver tu mensaje.' }
-                        ]
-                      }], true);
-                      // Guardar pending
-                      const notes = (tm.notes && typeof tm.notes === 'object') ? { ...tm.notes } : {};
-                      if (!notes.pending_mensaje) {
-                        notes.pending_mensaje = {
-                          texto: msgRow?.contenido || 'SARA te envió un mensaje. Responde para verlo.',
-                          timestamp: new Date().toISOString(),
-                          expires_at: new Date(Date.now() + 48 * 3600000).toISOString()
-                        };
-                        await supabase.client.from('team_members').update({ notes }).eq('id', tm.id);
-                      }
-                      console.log(`📱 131047 recovery OK: template resumen_vendedor → ${tm.name}`);
-                    } else {
-                      // ── LEAD → seguimiento_lead + pending ──
-                      const { data: leadMatch } = await supabase.client
-                        .from('leads')
-                        .select('id, name, notes, property_interest')
-                        .like('phone', `%${phoneSuffix}`)
-                        .limit(1);
-                      const lead = leadMatch?.[0];
-                      const nombreCorto = lead?.name?.split(' ')[0] || 'Amigo';
-                      const desarrollo = lead?.property_interest || 'nuestros desarrollos';
-                      await meta.sendTemplate(recipientId, 'seguimiento_lead', 'es_MX', [{
-                        type: 'body',
-                        parameters: [
-                          { type: 'text', text: nombreCorto },
-                          { type: 'text', text: desarrollo }
-                        ]
-                      }], true);
-                      // Guardar pending en lead
-                      if (lead?.id) {
-                        const notes = (lead.notes && typeof lead.notes === 'object') ? { ...lead.notes } : {};
-                        if (!notes.pending_mensaje) {
-                          notes.pending_mensaje = {
-                            texto: msgRow?.contenido || 'SARA te envió un mensaje. Responde para verlo.',
-                            timestamp: new Date().toISOString(),
-                            expires_at: new Date(Date.now() + 48 * 3600000).toISOString()
-                          };
-                          await supabase.client.from('leads').update({ notes }).eq('id', lead.id);
-                        }
-                      }
-                      console.log(`📱 131047 recovery OK: template seguimiento_lead → ${nombreCorto}`);
-                    }
-                  } catch (fallbackErr) {
-                    console.error(`❌ 131047 template fallback error: ${(fallbackErr as Error).message}`);
-                  }
-                } else {
-                  // Otros errores → encolar en retry_queue
-                  try {
-                    await enqueueFailedMessage(
-                      supabase,
-                      recipientId,
-                      'text',
-                      { body: `[Re-send from failed status: ${messageId}]`, originalMessageId: messageId },
-                      `Status webhook failed: ${errorCode}`,
-                      `Meta delivery failed: ${errorCode} - ${errorTitle}`
-                    );
-                  } catch (retryErr) { console.error('⚠️ Error encolando retry:', retryErr); }
-                }
-              }
-            } catch (dbError) {
-              // Si la tabla no existe, solo loguear
-              console.log(`📬 ${statusType.toUpperCase()}: ${recipientId} (tabla no existe, solo log)`);
-            }
-
-            // 🔊 TTS Tracking - Actualizar estado de mensajes TTS
-            if (statusType === 'delivered' || statusType === 'read' || statusType === 'failed') {
-              try {
-                const ttsTracking = createTTSTrackingService(supabase);
-                const updated = await ttsTracking.updateTTSStatus(
-                  messageId,
-                  statusType as 'delivered' | 'read' | 'failed',
-                  statusType === 'failed' ? errorTitle : undefined
-                );
-                if (updated) {
-                  console.log(`🔊 TTS Status actualizado: ${messageId.substring(0, 20)}... → ${statusType}`);
-                }
-              } catch (ttsError) {
-                console.error('⚠️ Error actualizando TTS status:', ttsError);
-              }
-
-              // 📬 Message Tracking - Actualizar estado de TODOS los mensajes
-              try {
-                const msgTracking = createMessageTrackingService(supabase);
-                await msgTracking.updateMessageStatus(
-                  messageId,
-                  statusType as 'delivered' | 'read' | 'failed',
-                  statusType === 'failed' ? errorTitle : undefined
-                );
-              } catch (msgError) {
-                console.error('⚠️ Error actualizando message tracking:', msgError);
-              }
-            }
+    return await processMetaWebhookBody(body, env, ctx, supabase);
+  } catch (error) {
+    console.error('❌ Meta Webhook Error:', error);
+    ctx.waitUntil(logErrorToDB(supabase, 'webhook_error', error instanceof Error ? error.message : String(error), {
+      severity: 'critical',
+      source: 'webhook:meta',
+      stack: error instanceof Error ? error.stack : undefined
+    }));
+    return new Response('OK', { status: 200 });
+  }
+}
+
+/**
+ * Consumidor de la cola de ingesta: cada mensaje con su propio SupabaseService
+ * (setTenant por lead). Las respuestas "replied" de todo el batch van a un solo
+ * buffer de contadores de campaña: 1 RPC por batch en vez de uno por mensaje.
+ * Devuelve los eventos que fallaron para que queue() los reintente.
+ */
+function metaInboundConsumer(env: Env, ctx: ExecutionContext): (events: InboundEvent[]) => Promise<InboundEvent[]> {
+  return async (events) => {
+    const replyCounters = createCampaignCounterBuffer(new SupabaseService(env.SUPABASE_URL, env.SUPABASE_ANON_KEY), { waitUntil: (p) => ctx.waitUntil(p) });
+    try {
+      return await consumeInboundEvents(events, {
+        onMessage: async (value) => {
+          const supabase = new SupabaseService(env.SUPABASE_URL, env.SUPABASE_ANON_KEY);
+          try {
+            await processMetaWebhookBody(toWebhookBody(value), env, ctx, supabase, { replyCounters, rethrow: true });
+          } finally {
+            reportEntityCache(supabase, 'inbound');
           }
-          return new Response('OK', { status: 200 });
+        },
+        onStatuses: async (value) => {
+          await processMetaWebhookBody(toWebhookBody(value), env, ctx, new SupabaseService(env.SUPABASE_URL, env.SUPABASE_ANON_KEY), { rethrow: true });
         }
+      });
+    } finally {
+      await replyCounters.flush();
+    }
+  };
+}
+
+/**
+ * Procesa un body ya verificado del webhook de Meta: estados de entrega y
+ * el primer mensaje. Lo llama el webhook en modo síncrono o el consumidor.
+ * opts.replyCounters: buffer compartido del batch (lo vacía el consumidor);
+ * sin él se usa uno propio y se vacía al terminar.
+ * opts.rethrow: el consumidor necesita el error para reintentar el mensaje;
+ * el webhook síncrono responde 200 igual (Meta reintenta por su cuenta).
+ */
+async function processMetaWebhookBody(
+  body: any,
+  env: Env,
+  ctx: ExecutionContext,
+  supabase: SupabaseService,
+  opts: { replyCounters?: CampaignCounterBuffer; rethrow?: boolean } = {}
+): Promise<Response> {
+  const { replyCounters } = opts;
+  let from: string | undefined;
+  let messageId: string | undefined;
+  let kvDedupKey: string | null = null;
+  try {
+    console.log('📥 Body recibido:', JSON.stringify(body).substring(0, 500));
+
+    const entry = body?.entry?.[0];
+    const changes = entry?.changes?.[0];
+    const value = changes?.value;
+    const messages = value?.messages;
+    const statuses = value?.statuses;
 
-        console.log('📥 Messages encontrados:', messages?.length || 0);
-
-        if (messages && messages.length > 0) {
-          const message = messages[0];
-          from = message.from;
-          messageId = message.id; // WhatsApp message ID para dedup
-          const messageType = message.type; // text, image, document, interactive, etc.
-
-          // ═══ EXTRAER TEXTO DEL MENSAJE (incluyendo respuestas interactivas) ═══
-          let text = '';
-          let buttonPayloadRaw = ''; // Raw payload/id para detectar carousel_ver_* etc.
-          if (messageType === 'text') {
-            text = message.text?.body || '';
-          } else if (messageType === 'interactive') {
-            // Respuesta a lista o botones
-            const interactiveType = message.interactive?.type;
-            if (interactiveType === 'list_reply') {
-              // Respuesta a lista: preferir título (legible) sobre ID
-              text = message.interactive.list_reply?.title || message.interactive.list_reply?.id || '';
-              buttonPayloadRaw = message.interactive.list_reply?.id || '';
-              console.log(`📋 Respuesta a LISTA: id="${message.interactive.list_reply?.id}", title="${message.interactive.list_reply?.title}"`);
-            } else if (interactiveType === 'button_reply') {
-              // Respuesta a botones: preferir título (legible) sobre ID (btn_xxx)
-              text = message.interactive.button_reply?.title || message.interactive.button_reply?.id || '';
-              buttonPayloadRaw = message.interactive.button_reply?.id || '';
-              console.log(`🔘 Respuesta a BOTÓN: id="${message.interactive.button_reply?.id}", title="${message.interactive.button_reply?.title}"`);
-            }
-          } else if (messageType === 'button') {
-            // Botón de template (diferente a interactive button)
-            text = message.button?.text || message.button?.payload || '';
-            buttonPayloadRaw = message.button?.payload || '';
-            console.log(`🔲 Respuesta a TEMPLATE BUTTON: "${text}", payload="${buttonPayloadRaw}"`);
-          }
-
-          console.log(`📥 Procesando mensaje de ${from}: tipo=${messageType}, texto="${text.substring(0, 50)}..."`);
-
-          // ═══ KV FAST DEDUP: Skip si ya procesamos este messageId ═══
-          // MARK-BEFORE + RECOVERY: Marca KV antes de procesar, pero si el procesamiento
-          // falla (catch línea ~1526), ELIMINA la entrada KV para que Meta pueda reintentar.
-          if (messageId) {
-            kvDedupKey = `wamsg:${messageId}`;
-            try {
-              const kvHit = await env.SARA_CACHE.get(kvDedupKey);
-              if (kvHit) {
-                console.log(`⏭️ KV dedup: ${messageId} already processed`);
-                return new Response('OK', { status: 200 });
-              }
-              await env.SARA_CACHE.put(kvDedupKey, '1', { expirationTtl: 86400 });
-            } catch (kvErr) {
-              console.warn('KV dedup failed, falling back to DB:', kvErr);
-            }
+    // ═══════════════════════════════════════════════════════════
+    // TRACKING DE ESTADOS DE ENTREGA (sent, delivered, read, failed)
+    // ═══════════════════════════════════════════════════════════
+    if (statuses && statuses.length > 0) {
+      const statusBuffer = createRequestTrackingBuffer(supabase, ctx);
+      const campaignCounters = createCampaignCounterBuffer(supabase, { waitUntil: (p) => ctx.waitUntil(p) });
+      // Estados en bloque: el más avanzado por message_id, 1 upsert monótono
+      // (sin dedup KV); solo las filas que avanzaron disparan efectos
+      const deliveryStatuses = createDeliveryStatusBuffer(supabase, {
+        throwOnError: opts.rethrow,
+        onApplied: async (rows) => {
+          const failed: DeliveryStatusRow[] = [];
+          for (const row of rows) {
+            console.log(`📬 STATUS UPDATE: ${row.status} | To: ${row.recipient_phone} | MsgID: ${row.message_id.substring(0, 30)}...`);
+            if (row.status === 'sent') continue;
+            // 📬 Message Tracking + 📣 contadores de campaña
+            statusBuffer.addStatus(row.message_id, row.status, row.status === 'failed' ? row.error_message || undefined : undefined);
+            campaignCounters.addStatus(row.message_id, row.status);
+            if (row.status === 'failed') failed.push(row);
           }
-
-          // ═══ DEDUPLICACIÓN: Evitar procesar mensajes rápidos duplicados ═══
-          const cleanPhone = from.replace(/\D/g, '');
-          const now = Date.now();
-
-          // Primero verificar si es un team_member (vendedor, CEO, asesor, etc.)
-          const { data: teamMember } = await supabase.client
-            .from('team_members')
-            .select('id, notes')
-            .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`)
-            .maybeSingle();
-
-          if (teamMember) {
-            // ═══ DEDUPLICACIÓN TEAM MEMBERS ═══
-            const tmNotes = safeJsonParse(teamMember.notes);
-            const tmLastMsgId = tmNotes.last_processed_msg_id;
-
-            // Si el mismo mensaje ID ya fue procesado, saltar
-            if (tmLastMsgId === messageId) {
-              console.log('⏭️ [TEAM] Mensaje ya procesado (mismo ID), saltando');
-              return new Response('OK', { status: 200 });
-            }
-
-            // Marcar este mensaje como en proceso
-            const { error: dedupTmErr } = await supabase.client
-              .from('team_members')
-              .update({
-                notes: {
-                  ...tmNotes,
-                  last_processed_msg_id: messageId,
-                  last_processed_msg_time: now
-                }
-              })
-              .eq('id', teamMember.id);
-            if (dedupTmErr) console.error('❌ Dedup team_member write failed:', dedupTmErr.message);
-            else console.log(`👤 [TEAM] Deduplicación OK para team_member ${teamMember.id}`);
-          } else {
-            // ═══ DEDUPLICACIÓN LEADS ═══
-            const { data: recentMsg } = await supabase.client
-              .from('leads')
-              .select('notes')
-              .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`)
-              .maybeSingle();
-
-            const leadNotes = safeJsonParse(recentMsg?.notes);
-            const lastMsgId = leadNotes.last_processed_msg_id;
-            const lastMsgTime = leadNotes.last_processed_msg_time;
-
-            // Si el mismo mensaje ID ya fue procesado, saltar
-            if (lastMsgId === messageId) {
-              console.log('⏭️ [LEAD] Mensaje ya procesado (mismo ID), saltando');
-              return new Response('OK', { status: 200 });
-            }
-
-            // Si hubo un mensaje procesado hace menos de 3 segundos, esperar y combinar
-            if (lastMsgTime && (now - lastMsgTime) < 3000) {
-              console.log('⏳ Mensaje muy rápido, esperando 2s para combinar...');
-              await new Promise(r => setTimeout(r, 2000));
+          // 🔊 TTS Tracking - Actualizar estado de mensajes TTS
+          await createTTSTrackingService(supabase).updateTTSStatuses(rows.filter(r => r.status !== 'sent'));
+
+          if (failed.length > 0) {
+            for (const row of failed) console.error(`❌ MENSAJE FALLIDO: ${row.recipient_phone} - Error ${row.error_code}: ${row.error_message}`);
+            // ── 131047 = ventana 24h cerrada → template fallback (en paralelo, fuera del flush) ──
+            const windowClosed = failed.filter(r => r.error_code === '131047');
+            if (windowClosed.length > 0) {
+              const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+              ctx.waitUntil(Promise.allSettled(windowClosed.map(r => sendWindowClosedFallback(supabase, meta, r.recipient_phone, r.message_id))));
             }
-
-            // Marcar este mensaje como en proceso
-            if (recentMsg) {
-              const { error: dedupLeadErr } = await supabase.client
-                .from('leads')
-                .update({
-                  notes: {
-                    ...leadNotes,
-                    last_processed_msg_id: messageId,
-                    last_processed_msg_time: now
-                  }
-                })
-                .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`);
-              if (dedupLeadErr) console.error('❌ Dedup lead write failed:', dedupLeadErr.message);
+            // Otros errores → encolar en retry_queue (1 insert)
+            const retryable = failed.filter(r => r.error_code !== '131047');
+            if (retryable.length > 0) {
+              await enqueueFailedMessages(supabase, retryable.map(r => ({
+                recipientPhone: r.recipient_phone,
+                messageType: 'text',
+                payload: { body: `[Re-send from failed status: ${r.message_id}]`, originalMessageId: r.message_id },
+                context: `Status webhook failed: ${r.error_code}`,
+                errorMessage: `Meta delivery failed: ${r.error_code} - ${r.error_message}`
+              })));
             }
           }
-          // ═══ FIN DEDUPLICACIÓN ═══
-
-          const claude = new ClaudeService(env.ANTHROPIC_API_KEY);
-
-          // Resolve tenant FIRST, then create per-tenant services
-          const phoneNumberId = value?.metadata?.phone_number_id || env.META_PHONE_NUMBER_ID;
-          const tenant = await resolveTenantFromWebhook(phoneNumberId, supabase);
-          await supabase.setTenant(tenant.tenantId);
-
-          // Block expired trial tenants — but ALWAYS create the lead first (never lose a lead)
-          if (tenant.plan === 'expired') {
-            console.warn(`⚠️ Tenant ${tenant.name} trial expired — saving lead then blocking`);
-            // Still create the lead so it's not lost
-            try {
-              const expiredCleanPhone = from.replace(/\D/g, '');
-              const { data: existingLead } = await supabase.client
-                .from('leads')
-                .select('id')
-                .like('phone', '%' + expiredCleanPhone.slice(-10))
-                .limit(1)
-                .maybeSingle();
-              if (!existingLead) {
-                await supabase.client.from('leads').insert({
-                  phone: expiredCleanPhone,
-                  status: 'new',
-                  score: 0,
-                  notes: { source: 'expired_trial_capture', original_message: text?.substring(0, 500) || '[media]' }
-                });
-                console.log(`📝 Lead saved despite expired trial: ${expiredCleanPhone}`);
-              }
-            } catch (e) {
-              console.error('❌ Failed to save lead for expired trial:', e);
-            }
-            return new Response('OK', { status: 200 });
-          }
-
-          // Use tenant config for Meta/Calendar (falls back to env vars if not configured)
-          const meta = await createMetaWithTracking(env, supabase, tenant.config);
-          const calendar = new CalendarService(
-            tenant.config.googleServiceAccountEmail || env.GOOGLE_SERVICE_ACCOUNT_EMAIL,
-            tenant.config.googlePrivateKey || env.GOOGLE_PRIVATE_KEY,
-            tenant.config.googleCalendarId || env.GOOGLE_CALENDAR_ID
-          );
-
-          const handler = new WhatsAppHandler(supabase, claude, meta as any, calendar, meta, tenant);
-
-          // ═══ REACTION ✅ al lead (fire-and-forget, después de crear meta) ═══
-          if (messageId && !teamMember && meta) {
-            try {
-              ctx.waitUntil(
-                meta.sendReaction(from, messageId, '✅').catch((e) => console.error('⚠️ Reaction failed:', e))
-              );
-            } catch (reactErr) { console.error('⚠️ Reaction setup error:', reactErr); }
-          }
-
-          // ═══ AVISO FUERA DE HORARIO — DESACTIVADO ═══
-          // SARA responde 24/7 con IA. No enviamos "fuera de horario" a leads.
-          // El servicio BusinessHoursService sigue disponible para otros usos
-          // (ej: coordinadores, reportes) pero NO interrumpe respuestas a leads.
-          // ═══ FIN AVISO FUERA DE HORARIO ═══
+        }
+      });
+      for (const status of statuses) deliveryStatuses.add(status);
+      const flushed = deliveryStatuses.flush().then(() => Promise.all([statusBuffer.flush(), campaignCounters.flush()]));
+      // Consumidor: esperar la escritura para que un error reintente el evento
+      if (opts.rethrow) await flushed;
+      else ctx.waitUntil(flushed);
+      return new Response('OK', { status: 200 });
+    }
+
+    console.log('📥 Messages encontrados:', messages?.length || 0);
+
+    if (messages && messages.length > 0) {
+      const message = messages[0];
+      from = message.from;
+      messageId = message.id; // WhatsApp message ID para dedup
+      const messageType = message.type; // text, image, document, interactive, etc.
+
+      // ═══ EXTRAER TEXTO DEL MENSAJE (incluyendo respuestas interactivas) ═══
+      let text = '';
+      let buttonPayloadRaw = ''; // Raw payload/id para detectar carousel_ver_* etc.
+      if (messageType === 'text') {
+        text = message.text?.body || '';
+      } else if (messageType === 'interactive') {
+        // Respuesta a lista o botones
+        const interactiveType = message.interactive?.type;
+        if (interactiveType === 'list_reply') {
+          // Respuesta a lista: preferir título (legible) sobre ID
+          text = message.interactive.list_reply?.title || message.interactive.list_reply?.id || '';
+          buttonPayloadRaw = message.interactive.list_reply?.id || '';
+          console.log(`📋 Respuesta a LISTA: id="${message.interactive.list_reply?.id}", title="${message.interactive.list_reply?.title}"`);
+        } else if (interactiveType === 'button_reply') {
+          // Respuesta a botones: preferir título (legible) sobre ID (btn_xxx)
+          text = message.interactive.button_reply?.title || message.interactive.button_reply?.id || '';
+          buttonPayloadRaw = message.interactive.button_reply?.id || '';
+          console.log(`🔘 Respuesta a BOTÓN: id="${message.interactive.button_reply?.id}", title="${message.interactive.button_reply?.title}"`);
+        }
+      } else if (messageType === 'button') {
+        // Botón de template (diferente a interactive button)
+        text = message.button?.text || message.button?.payload || '';
+        buttonPayloadRaw = message.button?.payload || '';
+        console.log(`🔲 Respuesta a TEMPLATE BUTTON: "${text}", payload="${buttonPayloadRaw}"`);
+      }
 
-          // ═══ GARANTÍA DE CREACIÓN DE LEAD ═══
-          // CRITICAL: Ensure lead exists BEFORE any message-type branching
-          // This prevents losing leads who send stickers, images, docs, or audio as first message
-          if (!teamMember) {
-            try {
-              const cleanPhoneForLead = from.replace(/\D/g, '');
-              const digits = cleanPhoneForLead.slice(-10);
-              const { data: existingLead } = await supabase.client
-                .from('leads')
-                .select('id')
-                .like('phone', '%' + digits)
-                .limit(1)
-                .maybeSingle();
-              if (!existingLead) {
-                // Import and use lead management to create lead with round-robin
-                const { LeadManagementService } = await import('./services/leadManagementService');
-                const leadMgmt = new LeadManagementService(supabase, env.SARA_CACHE);
-                const { lead: newLead } = await leadMgmt.getOrCreateLead(cleanPhoneForLead, profileName);
-                if (newLead) {
-                  console.log(`📝 Lead pre-created for non-text message: ${newLead.id} (${messageType})`);
-                }
-              }
-            } catch (leadErr) {
-              console.error('⚠️ Pre-create lead failed (non-blocking):', leadErr);
-            }
-          }
-          // ═══ FIN GARANTÍA DE CREACIÓN DE LEAD ═══
+      console.log(`📥 Procesando mensaje de ${from}: tipo=${messageType}, texto="${text.substring(0, 50)}..."`);
 
-          // ═══ MANEJO DE MENSAJES VACÍOS / WHITESPACE ═══
-          // Si el mensaje es puramente de texto pero vacío o solo whitespace, ignorar
-          if (messageType === 'text' && (!text || !text.trim())) {
-            console.log('⏭️ Mensaje vacío/whitespace recibido, ignorando');
+      // ═══ KV FAST DEDUP: Skip si ya procesamos este messageId ═══
+      // MARK-BEFORE + RECOVERY: Marca KV antes de procesar, pero si el procesamiento
+      // falla (catch línea ~1526), ELIMINA la entrada KV para que Meta pueda reintentar.
+      if (messageId) {
+        kvDedupKey = `wamsg:${messageId}`;
+        try {
+          const kvHit = await env.SARA_CACHE.get(kvDedupKey);
+          if (kvHit) {
+            console.log(`⏭️ KV dedup: ${messageId} already processed`);
             return new Response('OK', { status: 200 });
           }
+          await env.SARA_CACHE.put(kvDedupKey, '1', { expirationTtl: 86400 });
+        } catch (kvErr) {
+          console.warn('KV dedup failed, falling back to DB:', kvErr);
+        }
+      }
 
-          // ═══ MANEJO DE IMÁGENES PARA FLUJO DE CRÉDITO ═══
-          if (messageType === 'image' || messageType === 'document') {
-            console.log(`📸 Mensaje de tipo ${messageType} recibido`);
-
-            // Obtener el media_id
-            const mediaId = message.image?.id || message.document?.id;
-            const caption = message.image?.caption || message.document?.caption || '';
+      // ═══ DEDUPLICACIÓN: Evitar procesar mensajes rápidos duplicados ═══
+      const cleanPhone = from.replace(/\D/g, '');
+      const now = Date.now();
 
-            if (mediaId) {
-              try {
-                // Obtener URL del media
-                const mediaUrl = await meta.getMediaUrl(mediaId);
-                console.log(`📸 Media URL obtenida: ${mediaUrl ? 'OK' : 'ERROR'}`);
-
-                if (mediaUrl) {
-                  // Verificar si el lead está en flujo de crédito
-                  const { CreditFlowService } = await import('./services/creditFlowService');
-                  const creditService = new CreditFlowService(supabase, env.OPENAI_API_KEY);
-
-                  // Buscar lead
-                  const { data: lead } = await supabase.client
-                    .from('leads')
-                    .select('*')
-                    .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`)
-                    .maybeSingle();
-
-                  if (lead) {
-                    const enFlujoCredito = await creditService.estaEnFlujoCredito(lead.id);
-
-                    if (enFlujoCredito) {
-                      console.log(`🏦 Lead ${lead.id} en flujo de crédito - procesando documento`);
-
-                      const resultado = await creditService.procesarRespuesta(lead.id, caption);
-
-                      if (resultado) {
-                        await meta.sendWhatsAppMessage(from, resultado.respuesta);
-
-                        // Si hay acción de conectar asesor
-                        if (resultado.accion === 'conectar_asesor' && resultado.datos?.asesor) {
-                          const asesor = resultado.datos.asesor;
-                          const vendedorOriginalId = resultado.datos.vendedorOriginalId;
-
-                          // Enviar mensaje al cliente con datos del asesor
-                          const msgCliente = creditService.generarMensajeAsesor(
-                            asesor,
-                            resultado.context
-                          );
-                          await meta.sendWhatsAppMessage(from, msgCliente);
-
-                          // Notificar al asesor + vendedor original en paralelo (24h safe)
-                          const needAsesor = asesor.phone && asesor.is_active !== false;
-                          const needVendor = vendedorOriginalId && vendedorOriginalId !== asesor?.id;
-
-                          // Fetch ambos team members en paralelo
-                          const [asesorResult, vendedorResult] = await Promise.all([
-                            needAsesor
-                              ? supabase.client.from('team_members').select('*').eq('id', asesor.id).maybeSingle()
-                              : Promise.resolve({ data: null }),
-                            needVendor
-                              ? supabase.client.from('team_members').select('*').eq('id', vendedorOriginalId).maybeSingle()
-                              : Promise.resolve({ data: null })
-                          ]);
-
-                          const asesorFull = asesorResult.data;
-                          const vendedorOriginal = vendedorResult.data;
-
-                          // Enviar notificaciones en paralelo
-                          const notificaciones: Promise<any>[] = [];
-
-                          if (asesorFull) {
-                            const msgAsesor = creditService.generarNotificacionAsesor(lead, resultado.context);
-                            notificaciones.push(
-                              enviarMensajeTeamMember(supabase, meta, asesorFull, msgAsesor, {
-                                tipoMensaje: 'alerta_lead',
-                                guardarPending: true,
-                                pendingKey: 'pending_alerta_lead'
-                              }).then(() => console.log(`📤 Asesor ${asesor.name} notificado (enviarMensajeTeamMember)`))
-                            );
-                          }
-
-                          if (vendedorOriginal?.phone) {
-                            const msgVendedor = `🏦 *LEAD EN CRÉDITO HIPOTECARIO*\n\n` +
-                              `👤 *${resultado.context.lead_name}*\n` +
-                              `📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n` +
-                              `Tu lead fue asignado al asesor hipotecario *${asesor.name || 'N/A'}* para su trámite de crédito.\n\n` +
-                              `💡 Sigues siendo responsable de la venta. Cuando el crédito esté listo, coordina la visita.\n\n` +
-                              `Escribe *mis leads* para ver tu lista.`;
-                            notificaciones.push(
-                              enviarMensajeTeamMember(supabase, meta, vendedorOriginal, msgVendedor, {
-                                tipoMensaje: 'alerta_lead',
-                                guardarPending: true,
-                                pendingKey: 'pending_alerta_lead'
-                              }).then(() => console.log(`📤 Vendedor original ${vendedorOriginal.name} notificado del crédito`))
-                            );
-                          }
-
-                          if (notificaciones.length > 0) {
-                            await Promise.all(notificaciones);
-                          }
-                        }
-                      }
-
-                      console.log('✅ Documento de crédito procesado');
-                      return new Response('OK', { status: 200 });
-                    }
-                  }
+      // Primero verificar si es un team_member (vendedor, CEO, asesor, etc.)
+      const teamMember = await getEntityCache(supabase, env.SARA_CACHE).getTeamMemberByPhone(cleanPhone);
 
-                  // ═══ BROKER HIPOTECARIO - ANÁLISIS DE DOCUMENTOS ═══
-                  // Si el lead tiene needs_mortgage=true y asesor asignado, procesar como doc hipotecario
-                  const leadNotesBroker = safeJsonParse(lead.notes);
-                  const needsMortgage = leadNotesBroker.needs_mortgage === true;
-                  const asesorAsignado = leadNotesBroker.asesor_asignado || lead.assigned_advisor_id;
-
-                  if (needsMortgage && asesorAsignado) {
-                    try {
-                      console.log(`🏦 Lead ${lead.name} tiene needs_mortgage + asesor - procesando doc hipotecario`);
-
-                      // Meta media URLs require auth headers — download as base64 first
-                      const base64Data = await meta.downloadMediaAsBase64(mediaUrl);
-                      if (base64Data) {
-                        const dataUrl = `data:image/jpeg;base64,${base64Data}`;
-
-                        const { BrokerHipotecarioService } = await import('./services/brokerHipotecarioService');
-                        const brokerService = new BrokerHipotecarioService(supabase.client, env.OPENAI_API_KEY);
-
-                        const resultadoBroker = await brokerService.procesarDocumento(lead.id, dataUrl, lead.name || 'Cliente');
-
-                        // Enviar respuesta al lead
-                        await meta.sendWhatsAppMessage(from, resultadoBroker.respuesta);
-
-                        // Si todos los documentos están completos, notificar equipo
-                        if (resultadoBroker.todosCompletos) {
-                          const notifBroker: Promise<any>[] = [];
-
-                          // Notificar asesor asignado
-                          const asesorId = typeof asesorAsignado === 'string' ? asesorAsignado : String(asesorAsignado);
-                          const { data: asesorMember } = await supabase.client
-                            .from('team_members')
-                            .select('*')
-                            .eq('id', asesorId)
-                            .maybeSingle();
-
-                          if (asesorMember) {
-                            const msgAsesorBroker = `🏦 *DOCUMENTOS COMPLETOS*\n\n` +
-                              `👤 *${lead.name || 'Lead'}*\n` +
-                              `📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n` +
-                              `¡Ya tiene todos los documentos para el trámite hipotecario!\n` +
-                              `Revisa y continúa con el proceso.`;
-                            notifBroker.push(
-                              enviarMensajeTeamMember(supabase, meta, asesorMember, msgAsesorBroker, {
-                                tipoMensaje: 'alerta_lead',
-                                guardarPending: true,
-                                pendingKey: 'pending_alerta_lead'
-                              })
-                            );
-                          }
-
-                          // Notificar vendedor original
-                          const vendedorOrigId = leadNotesBroker.vendedor_original_id || lead.assigned_to;
-                          if (vendedorOrigId && vendedorOrigId !== asesorId) {
-                            const { data: vendedorMember } = await supabase.client
-                              .from('team_members')
-                              .select('*')
-                              .eq('id', vendedorOrigId)
-                              .maybeSingle();
-
-                            if (vendedorMember) {
-                              const msgVendedorBroker = `🏦 *DOCS HIPOTECARIOS LISTOS*\n\n` +
-                                `👤 *${lead.name || 'Lead'}*\n` +
-                                `📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n` +
-                                `Tu lead ya completó todos los documentos para su crédito.\n` +
-                                `El asesor procederá con el trámite.`;
-                              notifBroker.push(
-                                enviarMensajeTeamMember(supabase, meta, vendedorMember, msgVendedorBroker, {
-                                  tipoMensaje: 'alerta_lead',
-                                  guardarPending: true,
-                                  pendingKey: 'pending_alerta_lead'
-                                })
-                              );
-                            }
-                          }
-
-                          if (notifBroker.length > 0) {
-                            await Promise.all(notifBroker);
-                          }
-                        }
+      if (teamMember) {
+        // ═══ DEDUPLICACIÓN TEAM MEMBERS ═══
+        const tmNotes = safeJsonParse(teamMember.notes);
+        const tmLastMsgId = tmNotes.last_processed_msg_id;
 
-                        console.log('✅ Documento hipotecario procesado por BrokerService');
-                        return new Response('OK', { status: 200 });
-                      }
-                    } catch (brokerErr) {
-                      console.warn('⚠️ Error en BrokerHipotecarioService:', brokerErr);
-                      // Fall through to document collection / desperfecto handler
-                    }
-                  }
+        // Si el mismo mensaje ID ya fue procesado, saltar
+        if (tmLastMsgId === messageId) {
+          console.log('⏭️ [TEAM] Mensaje ya procesado (mismo ID), saltando');
+          return new Response('OK', { status: 200 });
+        }
 
-                  // ═══ DOCUMENT COLLECTION - Detectar documentos de crédito por caption/filename ═══
-                  try {
-                    const { DocumentCollectionService } = await import('./services/documentCollectionService');
-                    const docService = new DocumentCollectionService(supabase);
-                    const checklist = await docService.getChecklistStatus(lead.id);
-
-                    if (checklist && checklist.missing.length > 0) {
-                      const docCaption = message.image?.caption || message.document?.caption || message.document?.filename || '';
-                      const docFilename = message.document?.filename || '';
-                      const docMimeType = message.image?.mime_type || message.document?.mime_type || '';
-                      const docType = docService.detectDocumentType(docCaption, docFilename, docMimeType);
-
-                      if (docType) {
-                        const docMediaId = message.image?.id || message.document?.id;
-                        const updated = await docService.markDocumentReceived(lead.id, docType, docMediaId);
-                        const { MORTGAGE_DOCUMENTS } = await import('./services/documentCollectionService');
-                        const docName = MORTGAGE_DOCUMENTS.find((d: any) => d.id === docType)?.name || docType;
-
-                        await meta.sendWhatsAppMessage(from, `✅ Recibí tu *${docName}*. Progreso: ${updated.completionPct}%`);
-
-                        if (updated.missing.length === 0) {
-                          await meta.sendWhatsAppMessage(from, '🎉 ¡Documentos completos! Tu asesor los revisará pronto.');
-
-                          // Notify asesor
-                          const leadNotesDoc = safeJsonParse(lead.notes);
-                          const asesorIdDoc = leadNotesDoc.credit_flow_context?.asesor_id || lead.assigned_advisor_id || lead.asesor_banco_id;
-                          if (asesorIdDoc) {
-                            const { data: asesorDoc } = await supabase.client
-                              .from('team_members').select('*').eq('id', asesorIdDoc).maybeSingle();
-                            if (asesorDoc) {
-                              await enviarMensajeTeamMember(supabase, meta, asesorDoc,
-                                `📋 *DOCUMENTOS COMPLETOS*\n\n👤 *${lead.name || 'Lead'}*\n📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n¡Todos los documentos para crédito hipotecario recibidos!\nRevisa y continúa con el proceso.`,
-                                { tipoMensaje: 'alerta_lead', guardarPending: true, pendingKey: 'pending_alerta_lead' }
-                              );
-                            }
-                          }
-                        }
+        // Marcar este mensaje como en proceso
+        const dedupNotes = {
+          ...tmNotes,
+          last_processed_msg_id: messageId,
+          last_processed_msg_time: now
+        };
+        const { error: dedupTmErr } = await supabase.client
+          .from('team_members')
+          .update({ notes: dedupNotes })
+          .eq('id', teamMember.id);
+        if (dedupTmErr) console.error('❌ Dedup team_member write failed:', dedupTmErr.message);
+        else {
+          getEntityCache(supabase).patchTeamMember(teamMember.id, { notes: dedupNotes });
+          console.log(`👤 [TEAM] Deduplicación OK para team_member ${teamMember.id}`);
+        }
+      } else {
+        // 📣 Respuesta de lead → contador "replied" del broadcast reciente
+        if (replyCounters) {
+          replyCounters.addReply(cleanPhone);
+        } else {
+          const counters = createCampaignCounterBuffer(supabase);
+          counters.addReply(cleanPhone);
+          ctx.waitUntil(counters.flush());
+        }
 
-                        console.log(`📋 Document collection: ${docName} received for lead ${lead.id} (${updated.completionPct}%)`);
-                        return new Response('OK', { status: 200 });
-                      }
-                    }
-                  } catch (docCollErr) {
-                    console.warn('⚠️ Error en DocumentCollectionService:', docCollErr);
-                    // Fall through to desperfecto handler
-                  }
-                }
-              } catch (imgErr) {
-                console.error('❌ Error procesando imagen:', imgErr);
-              }
-            }
+        // ═══ DEDUPLICACIÓN LEADS ═══
+        const { data: recentMsg } = await supabase.client
+          .from('leads')
+          .select('notes')
+          .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`)
+          .maybeSingle();
 
-            // ═══ DETECCIÓN DE FOTOS DE DESPERFECTOS (CLIENTES POST-ENTREGA) ═══
-            // caption ya definido arriba en línea 5839
-            const captionLower = caption.toLowerCase();
-
-            // Palabras clave que indican desperfectos/problemas
-            const palabrasDesperfecto = [
-              'humedad', 'húmedo', 'mojado', 'goteras', 'gotera', 'fuga', 'fugas',
-              'grieta', 'grietas', 'fisura', 'fisuras', 'cuarteado', 'cuarteadura',
-              'rotura', 'roto', 'rota', 'dañado', 'dañada', 'daño', 'desperfecto',
-              'mancha', 'manchas', 'moho', 'hongos', 'filtración', 'filtra',
-              'problema', 'defecto', 'mal estado', 'deterioro', 'deteriorado',
-              'pintura', 'descascarado', 'ampolla', 'burbuja',
-              'puerta', 'ventana', 'no cierra', 'no abre', 'atorado', 'atorada',
-              'piso', 'azulejo', 'loseta', 'levantado', 'quebrado',
-              'tubería', 'drenaje', 'atascado', 'tapado', 'no sirve',
-              'luz', 'eléctrico', 'apagón', 'corto', 'chispa',
-              'techo', 'plafón', 'caído', 'cayendo'
-            ];
+        const leadNotes = safeJsonParse(recentMsg?.notes);
+        const lastMsgId = leadNotes.last_processed_msg_id;
+        const lastMsgTime = leadNotes.last_processed_msg_time;
 
-            const esReporteDesperfecto = palabrasDesperfecto.some(p => captionLower.includes(p));
+        // Si el mismo mensaje ID ya fue procesado, saltar
+        if (lastMsgId === messageId) {
+          console.log('⏭️ [LEAD] Mensaje ya procesado (mismo ID), saltando');
+          return new Response('OK', { status: 200 });
+        }
 
-            // Buscar lead para verificar si es cliente post-entrega
-            const { data: leadImg } = await supabase.client
-              .from('leads')
-              .select('*, team_members!leads_assigned_to_fkey(phone, name)')
-              .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`)
-              .maybeSingle();
+        // Si hubo un mensaje procesado hace menos de 3 segundos, esperar y combinar
+        if (lastMsgTime && (now - lastMsgTime) < 3000) {
+          console.log('⏳ Mensaje muy rápido, esperando 2s para combinar...');
+          await new Promise(r => setTimeout(r, 2000));
+        }
 
-            const esClientePostEntrega = leadImg && ['delivered', 'sold', 'closed'].includes(leadImg.status);
-
-            // Si es cliente post-entrega y manda foto (con o sin caption de desperfecto)
-            if (esClientePostEntrega && (esReporteDesperfecto || !caption)) {
-              console.log(`🏠 Foto de posible desperfecto de cliente post-entrega: ${leadImg.name}`);
-
-              // Notificar al vendedor asignado
-              const vendedor = leadImg.team_members;
-              if (vendedor?.phone) {
-                const tipoProblema = esReporteDesperfecto ? `"${caption}"` : '(sin descripción)';
-                await meta.sendWhatsAppMessage(vendedor.phone,
-                  `🚨 *REPORTE DE CLIENTE*\n\n` +
-                  `👤 ${leadImg.name}\n` +
-                  `📱 ${leadImg.phone ? formatPhoneForDisplay(leadImg.phone) : 'Sin tel'}\n` +
-                  `🏠 Cliente entregado\n` +
-                  `📸 Envió foto ${tipoProblema}\n\n` +
-                  `Por favor contacta al cliente para dar seguimiento.`
-                );
-                console.log(`📤 Vendedor ${vendedor.name} notificado del reporte`);
+        // Marcar este mensaje como en proceso
+        if (recentMsg) {
+          const { error: dedupLeadErr } = await supabase.client
+            .from('leads')
+            .update({
+              notes: {
+                ...leadNotes,
+                last_processed_msg_id: messageId,
+                last_processed_msg_time: now
               }
+            })
+            .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`);
+          if (dedupLeadErr) console.error('❌ Dedup lead write failed:', dedupLeadErr.message);
+        }
+      }
+      // ═══ FIN DEDUPLICACIÓN ═══
 
-              // También notificar al CEO
-              const CEO_PHONE = '5214922019052';
-              await meta.sendWhatsAppMessage(CEO_PHONE,
-                `🚨 *REPORTE POST-ENTREGA*\n\n` +
-                `👤 ${leadImg.name}\n` +
-                `📱 ${leadImg.phone ? formatPhoneForDisplay(leadImg.phone) : 'Sin tel'}\n` +
-                `📸 Envió foto: ${caption || '(sin descripción)'}\n` +
-                `👷 Vendedor: ${vendedor?.name || 'Sin asignar'}`
-              );
-
-              // Responder al cliente
-              await meta.sendWhatsAppMessage(from,
-                `📸 Recibí tu foto${caption ? ` sobre: "${caption}"` : ''}.\n\n` +
-                `Tu reporte ha sido registrado y ${vendedor?.name || 'nuestro equipo'} te contactará pronto para dar seguimiento.\n\n` +
-                `Si es algo urgente, puedes llamarnos directamente. ¡Gracias por reportarlo! 🏠`
-              );
-
-              // Guardar nota en el lead
-              const notaActual = leadImg.notes || [];
-              const nuevaNota = {
-                text: `📸 REPORTE CON FOTO: ${caption || 'Imagen sin descripción'}`,
-                author: 'SARA',
-                timestamp: new Date().toISOString(),
-                type: 'system'
-              };
-              await supabase.client
-                .from('leads')
-                .update({ notes: [...notaActual, nuevaNota] })
-                .eq('id', leadImg.id);
-
-              return new Response('OK', { status: 200 });
-            }
-
-            // Si hay caption con palabras de desperfecto pero NO es cliente post-entrega
-            // (podría ser lead mostrando su casa actual)
-            if (esReporteDesperfecto && leadImg && !esClientePostEntrega) {
-              console.log(`📸 Lead ${leadImg.name} envió foto con descripción de problema (no es post-entrega)`);
-              await meta.sendWhatsAppMessage(from,
-                `📸 Veo que me compartes una foto. ¿Es de tu casa actual?\n\n` +
-                `Si estás buscando mudarte por esos problemas, ¡tengo casas nuevas desde $1.5M! 🏠\n\n` +
-                `¿Te gustaría conocer nuestros desarrollos?`
-              );
-              return new Response('OK', { status: 200 });
-            }
+      const claude = new ClaudeService(env.ANTHROPIC_API_KEY);
 
-            // ═══ RESPUESTA GENÉRICA PARA DOCUMENTOS (PDF/Word/etc) ═══
-            if (messageType === 'document') {
-              const docName = message.document?.filename || 'documento';
-              console.log(`📄 Documento genérico recibido: ${docName}`);
-              await meta.sendWhatsAppMessage(from,
-                `📄 Recibimos tu documento "${docName}".\n\n` +
-                `Un asesor lo revisará y te contactará. ¡Gracias!`);
-              return new Response('OK', { status: 200 });
-            }
+      // Resolve tenant FIRST, then create per-tenant services
+      const phoneNumberId = value?.metadata?.phone_number_id || env.META_PHONE_NUMBER_ID;
+      const tenant = await resolveTenantFromWebhook(phoneNumberId, supabase);
+      await supabase.setTenant(tenant.tenantId);
 
-            // Respuesta genérica para otras imágenes
-            if (!text && !caption) {
-              await meta.sendWhatsAppMessage(from,
-                '📷 Recibí tu imagen. ¿En qué te puedo ayudar?\n\n' +
-                '🏠 Si buscas casa, tenemos opciones desde $1.5M\n' +
-                '💳 Si necesitas crédito, escríbeme "quiero crédito"');
-              return new Response('OK', { status: 200 });
-            }
+      // Block expired trial tenants — but ALWAYS create the lead first (never lose a lead)
+      if (tenant.plan === 'expired') {
+        console.warn(`⚠️ Tenant ${tenant.name} trial expired — saving lead then blocking`);
+        // Still create the lead so it's not lost
+        try {
+          const expiredCleanPhone = from.replace(/\D/g, '');
+          const { data: existingLead } = await supabase.client
+            .from('leads')
+            .select('id')
+            .like('phone', '%' + expiredCleanPhone.slice(-10))
+            .limit(1)
+            .maybeSingle();
+          if (!existingLead) {
+            await supabase.client.from('leads').insert({
+              phone: expiredCleanPhone,
+              status: 'new',
+              score: 0,
+              notes: { source: 'expired_trial_capture', original_message: text?.substring(0, 500) || '[media]' }
+            });
+            console.log(`📝 Lead saved despite expired trial: ${expiredCleanPhone}`);
           }
-          // ═══ FIN MANEJO DE IMÁGENES ═══
-
-          // ═══ MANEJO DE AUDIOS/NOTAS DE VOZ ═══
-          if (messageType === 'audio') {
-            console.log(`🎤 Mensaje de audio recibido`);
+        } catch (e) {
+          console.error('❌ Failed to save lead for expired trial:', e);
+        }
+        return new Response('OK', { status: 200 });
+      }
 
-            const audioId = message.audio?.id;
-            const audioMimeType = message.audio?.mime_type || 'audio/ogg';
+      // Use tenant config for Meta/Calendar (falls back to env vars if not configured)
+      const meta = await createMetaWithTracking(env, supabase, tenant.config, createRequestTrackingBuffer(supabase, ctx));
+      const calendar = new CalendarService(
+        tenant.config.googleServiceAccountEmail || env.GOOGLE_SERVICE_ACCOUNT_EMAIL,
+        tenant.config.googlePrivateKey || env.GOOGLE_PRIVATE_KEY,
+        tenant.config.googleCalendarId || env.GOOGLE_CALENDAR_ID
+      );
 
-            if (audioId && env.OPENAI_API_KEY) {
-              try {
-                const audioService = createAudioTranscription(env.OPENAI_API_KEY, env.META_ACCESS_TOKEN);
-                const transcription = await audioService.processWhatsAppAudio({
-                  mediaId: audioId,
-                  mimeType: audioMimeType
-                });
+      const handler = new WhatsAppHandler(supabase, claude, meta as any, calendar, meta, tenant, (p) => ctx.waitUntil(p));
 
-                if (transcription.success && transcription.text) {
-                  console.log(`✅ Audio transcrito: "${transcription.text.substring(0, 100)}..."`);
-
-                  // Marcar en el lead que el último mensaje fue audio (para TTS en respuesta)
-                  const cleanPhoneAudio = from.replace(/\D/g, '');
-                  const { data: leadForAudio } = await supabase.client
-                    .from('leads')
-                    .select('id, notes')
-                    .or(`phone.eq.${cleanPhoneAudio},phone.like.%${cleanPhoneAudio.slice(-10)}`)
-                    .maybeSingle();
-
-                  if (leadForAudio) {
-                    const notesAudio = typeof leadForAudio.notes === 'object' ? leadForAudio.notes : {};
-                    await supabase.client
-                      .from('leads')
-                      .update({ notes: { ...notesAudio, last_message_was_audio: true } })
-                      .eq('id', leadForAudio.id);
-                    console.log('🎤 Marcado: último mensaje fue audio (TTS activado para respuesta)');
-                  }
+      // ═══ REACTION ✅ al lead (fire-and-forget, después de crear meta) ═══
+      if (messageId && !teamMember && meta) {
+        try {
+          ctx.waitUntil(
+            meta.sendReaction(from, messageId, '✅').catch((e) => console.error('⚠️ Reaction failed:', e))
+          );
+        } catch (reactErr) { console.error('⚠️ Reaction setup error:', reactErr); }
+      }
 
-                  // Procesar el texto transcrito como si fuera un mensaje normal
-                  const handler = new WhatsAppHandler(supabase, claude, meta as any, calendar, meta, tenant);
-                  await handler.handleIncomingMessage(`whatsapp:+${from}`, transcription.text, env);
+      // ═══ AVISO FUERA DE HORARIO — DESACTIVADO ═══
+      // SARA responde 24/7 con IA. No enviamos "fuera de horario" a leads.
+      // El servicio BusinessHoursService sigue disponible para otros usos
+      // (ej: coordinadores, reportes) pero NO interrumpe respuestas a leads.
+      // ═══ FIN AVISO FUERA DE HORARIO ═══
 
-                  console.log('✅ Audio procesado correctamente');
-                  return new Response('OK', { status: 200 });
-                } else {
-                  // Si falla la transcripción, responder amigablemente
-                  console.log(`⚠️ No se pudo transcribir audio: ${transcription.error}`);
-                  await meta.sendWhatsAppMessage(from,
-                    '🎤 Recibí tu nota de voz, pero no pude escucharla bien. ¿Podrías escribirme tu mensaje? Así te ayudo mejor 😊');
-                  return new Response('OK', { status: 200 });
-                }
-              } catch (audioErr) {
-                console.error('❌ Error procesando audio:', audioErr);
-                await meta.sendWhatsAppMessage(from,
-                  '🎤 Recibí tu audio. Por el momento prefiero mensajes de texto para atenderte mejor. ¿En qué te puedo ayudar? 🏠');
-                return new Response('OK', { status: 200 });
-              }
-            } else {
-              // No hay API key de OpenAI - respuesta genérica
-              await meta.sendWhatsAppMessage(from,
-                '🎤 Recibí tu nota de voz. Por el momento trabajo mejor con mensajes de texto. ¿Podrías escribirme en qué te puedo ayudar? 🏠');
-              return new Response('OK', { status: 200 });
+      // ═══ GARANTÍA DE CREACIÓN DE LEAD ═══
+      // CRITICAL: Ensure lead exists BEFORE any message-type branching
+      // This prevents losing leads who send stickers, images, docs, or audio as first message
+      if (!teamMember) {
+        try {
+          const cleanPhoneForLead = from.replace(/\D/g, '');
+          const digits = cleanPhoneForLead.slice(-10);
+          const { data: existingLead } = await supabase.client
+            .from('leads')
+            .select('id')
+            .like('phone', '%' + digits)
+            .limit(1)
+            .maybeSingle();
+          if (!existingLead) {
+            // Import and use lead management to create lead with round-robin
+            const { LeadManagementService } = await import('./services/leadManagementService');
+            const leadMgmt = new LeadManagementService(supabase, env.SARA_CACHE);
+            const { lead: newLead } = await leadMgmt.getOrCreateLead(cleanPhoneForLead, profileName);
+            if (newLead) {
+              console.log(`📝 Lead pre-created for non-text message: ${newLead.id} (${messageType})`);
             }
           }
-          // ═══ FIN MANEJO DE AUDIOS ═══
+        } catch (leadErr) {
+          console.error('⚠️ Pre-create lead failed (non-blocking):', leadErr);
+        }
+      }
+      // ═══ FIN GARANTÍA DE CREACIÓN DE LEAD ═══
 
-          // ═══ MANEJO DE STICKERS Y GIFS ═══
-          if (messageType === 'sticker') {
-            console.log(`😄 Sticker recibido - ignorando silenciosamente`);
-            return new Response('OK', { status: 200 });
-          }
-          // ═══ FIN MANEJO DE STICKERS ═══
+      // ═══ MANEJO DE MENSAJES VACÍOS / WHITESPACE ═══
+      // Si el mensaje es puramente de texto pero vacío o solo whitespace, ignorar
+      if (messageType === 'text' && (!text || !text.trim())) {
+        console.log('⏭️ Mensaje vacío/whitespace recibido, ignorando');
+        return new Response('OK', { status: 200 });
+      }
 
-          // ═══ MANEJO DE UBICACIÓN ═══
-          if (messageType === 'location') {
-            const lat = message.location?.latitude;
-            const lon = message.location?.longitude;
-            const locName = message.location?.name || '';
-            const locAddress = message.location?.address || '';
-            console.log(`📍 Ubicación recibida: lat=${lat}, lon=${lon}, name=${locName}`);
+      // ═══ MANEJO DE IMÁGENES PARA FLUJO DE CRÉDITO ═══
+      if (messageType === 'image' || messageType === 'document') {
+        console.log(`📸 Mensaje de tipo ${messageType} recibido`);
 
-            // Guardar ubicación en lead.notes
-            try {
-              const cleanPhoneLoc = from.replace(/\D/g, '');
-              const { data: leadLoc } = await supabase.client
+        // Obtener el media_id
+        const mediaId = message.image?.id || message.document?.id;
+        const caption = message.image?.caption || message.document?.caption || '';
+
+        if (mediaId) {
+          try {
+            // Obtener URL del media
+            const mediaUrl = await meta.getMediaUrl(mediaId);
+            console.log(`📸 Media URL obtenida: ${mediaUrl ? 'OK' : 'ERROR'}`);
+
+            if (mediaUrl) {
+              // Verificar si el lead está en flujo de crédito
+              const { CreditFlowService } = await import('./services/creditFlowService');
+              const creditService = new CreditFlowService(supabase, env.OPENAI_API_KEY);
+
+              // Buscar lead
+              const { data: lead } = await supabase.client
                 .from('leads')
-                .select('id, notes')
-                .or(`phone.eq.${cleanPhoneLoc},phone.like.%${cleanPhoneLoc.slice(-10)}`)
+                .select('*')
+                .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`)
                 .maybeSingle();
-              if (leadLoc) {
-                const locNotes = typeof leadLoc.notes === 'object' && leadLoc.notes ? leadLoc.notes : {};
-                await supabase.client.from('leads').update({
-                  notes: { ...locNotes, location: { lat, lon, name: locName, address: locAddress, saved_at: new Date().toISOString() } }
-                }).eq('id', leadLoc.id);
-                console.log(`📍 Ubicación guardada en lead ${leadLoc.id}`);
-              }
-            } catch (locErr) {
-              console.error('Error guardando ubicación:', locErr);
-            }
 
-            // ═══ LOCATION SERVICE: Verificar si está en zona Zacatecas ═══
-            if (lat && lon) {
-              const locationService = new LocationService();
-              if (!locationService.isInZacatecasArea(lat, lon)) {
-                console.log(`📍 Ubicación fuera de zona Zacatecas (${lat}, ${lon})`);
-                // Still show developments but mention they're far
-              }
-            }
+              if (lead) {
+                const enFlujoCredito = await creditService.estaEnFlujoCredito(lead.id);
 
-            // ═══ HAVERSINE: Calcular distancia a cada desarrollo ═══
-            const GPS_DESARROLLOS: Array<{ name: string; lat: number; lon: number; zona: string }> = [
-              { name: 'Monte Verde', lat: 22.7685, lon: -102.5557, zona: 'Colinas del Padre' },
-              { name: 'Los Encinos', lat: 22.7690, lon: -102.5560, zona: 'Colinas del Padre' },
-              { name: 'Miravalle', lat: 22.7695, lon: -102.5555, zona: 'Colinas del Padre' },
-              { name: 'Paseo Colorines', lat: 22.7680, lon: -102.5550, zona: 'Colinas del Padre' },
-              { name: 'Andes', lat: 22.7650, lon: -102.5100, zona: 'Guadalupe' },
-              { name: 'Distrito Falco', lat: 22.7700, lon: -102.5200, zona: 'Guadalupe' },
-              { name: 'Villa Campelo', lat: 22.7600, lon: -102.5150, zona: 'Citadella del Nogal' },
-              { name: 'Villa Galiano', lat: 22.7605, lon: -102.5155, zona: 'Citadella del Nogal' },
-            ];
+                if (enFlujoCredito) {
+                  console.log(`🏦 Lead ${lead.id} en flujo de crédito - procesando documento`);
 
-            if (lat && lon) {
-              // Haversine formula
-              const toRad = (deg: number) => deg * Math.PI / 180;
-              const haversine = (lat1: number, lon1: number, lat2: number, lon2: number): number => {
-                const R = 6371; // km
-                const dLat = toRad(lat2 - lat1);
-                const dLon = toRad(lon2 - lon1);
-                const a = Math.sin(dLat / 2) ** 2 + Math.cos(toRad(lat1)) * Math.cos(toRad(lat2)) * Math.sin(dLon / 2) ** 2;
-                return R * 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1 - a));
-              };
-
-              const distancias = GPS_DESARROLLOS.map(d => ({
-                ...d,
-                distancia: haversine(lat, lon, d.lat, d.lon)
-              })).sort((a, b) => a.distancia - b.distancia);
-
-              // Top 3 más cercanos con precios dinámicos
-              const { data: locProps } = await supabase.client.from('properties').select('development_name, name, price_equipped, price, gps_link').limit(50);
-              const allProps = locProps || [];
-              const top3 = distancias.slice(0, 3);
-
-              let respuesta = `📍 ¡Gracias por tu ubicación! Los desarrollos más cercanos a ti son:\n`;
-              for (const dev of top3) {
-                const distKm = dev.distancia.toFixed(1);
-                const precio = AIConversationService.precioMinDesarrollo(allProps, dev.name);
-                respuesta += `\n🏘️ *${dev.name}* (${dev.zona})\n   📏 ~${distKm} km — Desde ${precio}\n`;
-              }
-              respuesta += `\n¿Cuál te gustaría visitar?`;
+                  const resultado = await creditService.procesarRespuesta(lead.id, caption);
 
-              await meta.sendWhatsAppMessage(from, respuesta);
+                  if (resultado) {
+                    await meta.sendWhatsAppMessage(from, resultado.respuesta);
 
-              // CTA button del más cercano (si tiene GPS link)
-              const nearest = top3[0];
-              const nearestProp = allProps.find(p =>
-                (p.development_name || '').toLowerCase().includes(nearest.name.toLowerCase()) && p.gps_link
-              );
-              if (nearestProp?.gps_link) {
-                await new Promise(r => setTimeout(r, 300));
-                try {
-                  await meta.sendCTAButton(from,
-                    `📍 ${nearest.name} es el más cercano a ti (~${nearest.distancia.toFixed(1)} km)`,
-                    'Ver ubicación 📍',
-                    nearestProp.gps_link
-                  );
-                } catch (ctaErr: any) {
-                  console.error(`❌ CTA location falló: ${ctaErr.message?.slice(0, 200)}`);
+                    // Si hay acción de conectar asesor
+                    if (resultado.accion === 'conectar_asesor' && resultado.datos?.asesor) {
+                      const asesor = resultado.datos.asesor;
+                      const vendedorOriginalId = resultado.datos.vendedorOriginalId;
+
+                      // Enviar mensaje al cliente con datos del asesor
+                      const msgCliente = creditService.generarMensajeAsesor(
+                        asesor,
+                        resultado.context
+                      );
+                      await meta.sendWhatsAppMessage(from, msgCliente);
+
+                      // Notificar al asesor + vendedor original en paralelo (24h safe)
+                      const needAsesor = asesor.phone && asesor.is_active !== false;
+                      const needVendor = vendedorOriginalId && vendedorOriginalId !== asesor?.id;
+
+                      // Fetch ambos team members en paralelo
+                      const [asesorFull, vendedorOriginal] = await Promise.all([
+                        needAsesor ? getEntityCache(supabase).getTeamMemberById(asesor.id) : Promise.resolve(null),
+                        needVendor ? getEntityCache(supabase).getTeamMemberById(vendedorOriginalId) : Promise.resolve(null)
+                      ]);
+
+                      // Enviar notificaciones en paralelo
+                      const notificaciones: Promise<any>[] = [];
+
+                      if (asesorFull) {
+                        const msgAsesor = creditService.generarNotificacionAsesor(lead, resultado.context);
+                        notificaciones.push(
+                          enviarMensajeTeamMember(supabase, meta, asesorFull, msgAsesor, {
+                            tipoMensaje: 'alerta_lead',
+                            guardarPending: true,
+                            pendingKey: 'pending_alerta_lead'
+                          }).then(() => console.log(`📤 Asesor ${asesor.name} notificado (enviarMensajeTeamMember)`))
+                        );
+                      }
+
+                      if (vendedorOriginal?.phone) {
+                        const msgVendedor = `🏦 *LEAD EN CRÉDITO HIPOTECARIO*\n\n` +
+                          `👤 *${resultado.context.lead_name}*\n` +
+                          `📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n` +
+                          `Tu lead fue asignado al asesor hipotecario *${asesor.name || 'N/A'}* para su trámite de crédito.\n\n` +
+                          `💡 Sigues siendo responsable de la venta. Cuando el crédito esté listo, coordina la visita.\n\n` +
+                          `Escribe *mis leads* para ver tu lista.`;
+                        notificaciones.push(
+                          enviarMensajeTeamMember(supabase, meta, vendedorOriginal, msgVendedor, {
+                            tipoMensaje: 'alerta_lead',
+                            guardarPending: true,
+                            pendingKey: 'pending_alerta_lead'
+                          }).then(() => console.log(`📤 Vendedor original ${vendedorOriginal.name} notificado del crédito`))
+                        );
+                      }
+
+                      if (notificaciones.length > 0) {
+                        await Promise.all(notificaciones);
+                      }
+                    }
+                  }
+
+                  console.log('✅ Documento de crédito procesado');
+                  return new Response('OK', { status: 200 });
                 }
               }
-            } else {
-              // Sin coordenadas válidas — fallback con precios dinámicos
-              const { data: fallbackProps } = await supabase.client.from('properties').select('development_name, name, price_equipped, price').limit(50);
-              const fbProps = fallbackProps || [];
-              const listaDesarrollos = AIConversationService.listaBulletDesarrollos(fbProps);
-              await meta.sendWhatsAppMessage(from,
-                `📍 ¡Gracias por tu ubicación!\n\nNuestros desarrollos en *Zacatecas*:\n\n${listaDesarrollos}\n\n¿Cuál te gustaría conocer?`);
-            }
-            return new Response('OK', { status: 200 });
-          }
-          // ═══ FIN MANEJO DE UBICACIÓN ═══
 
-          // ═══ MANEJO DE REACCIONES ═══
-          if (messageType === 'reaction') {
-            console.log(`👍 Reacción recibida: ${message.reaction?.emoji}`);
+              // ═══ BROKER HIPOTECARIO - ANÁLISIS DE DOCUMENTOS ═══
+              // Si el lead tiene needs_mortgage=true y asesor asignado, procesar como doc hipotecario
+              const leadNotesBroker = safeJsonParse(lead.notes);
+              const needsMortgage = leadNotesBroker.needs_mortgage === true;
+              const asesorAsignado = leadNotesBroker.asesor_asignado || lead.assigned_advisor_id;
 
-            const emoji = message.reaction?.emoji;
+              if (needsMortgage && asesorAsignado) {
+                try {
+                  console.log(`🏦 Lead ${lead.name} tiene needs_mortgage + asesor - procesando doc hipotecario`);
+
+                  // Meta media URLs require auth headers — download as base64 first
+                  const base64Data = await meta.downloadMediaAsBase64(mediaUrl);
+                  if (base64Data) {
+                    const dataUrl = `data:image/jpeg;base64,${base64Data}`;
+
+                    const { BrokerHipotecarioService } = await import('./services/brokerHipotecarioService');
+                    const brokerService = new BrokerHipotecarioService(supabase.client, env.OPENAI_API_KEY);
+
+                    const resultadoBroker = await brokerService.procesarDocumento(lead.id, dataUrl, lead.name || 'Cliente');
+
+                    // Enviar respuesta al lead
+                    await meta.sendWhatsAppMessage(from, resultadoBroker.respuesta);
+
+                    // Si todos los documentos están completos, notificar equipo
+                    if (resultadoBroker.todosCompletos) {
+                      const notifBroker: Promise<any>[] = [];
+
+                      // Notificar asesor asignado
+                      const asesorId = typeof asesorAsignado === 'string' ? asesorAsignado : String(asesorAsignado);
+                      const asesorMember = await getEntityCache(supabase).getTeamMemberById(asesorId);
+
+                      if (asesorMember) {
+                        const msgAsesorBroker = `🏦 *DOCUMENTOS COMPLETOS*\n\n` +
+                          `👤 *${lead.name || 'Lead'}*\n` +
+                          `📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n` +
+                          `¡Ya tiene todos los documentos para el trámite hipotecario!\n` +
+                          `Revisa y continúa con el proceso.`;
+                        notifBroker.push(
+                          enviarMensajeTeamMember(supabase, meta, asesorMember, msgAsesorBroker, {
+                            tipoMensaje: 'alerta_lead',
+                            guardarPending: true,
+                            pendingKey: 'pending_alerta_lead'
+                          })
+                        );
+                      }
 
-            // Ignorar reacciones negativas silenciosamente
-            if (emoji === '👎' || emoji === '😡' || emoji === '😠') {
-              console.log('⚠️ Reacción negativa - no responder');
-              return new Response('OK', { status: 200 });
-            }
+                      // Notificar vendedor original
+                      const vendedorOrigId = leadNotesBroker.vendedor_original_id || lead.assigned_to;
+                      if (vendedorOrigId && vendedorOrigId !== asesorId) {
+                        const vendedorMember = await getEntityCache(supabase).getTeamMemberById(vendedorOrigId);
+
+                        if (vendedorMember) {
+                          const msgVendedorBroker = `🏦 *DOCS HIPOTECARIOS LISTOS*\n\n` +
+                            `👤 *${lead.name || 'Lead'}*\n` +
+                            `📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n` +
+                            `Tu lead ya completó todos los documentos para su crédito.\n` +
+                            `El asesor procederá con el trámite.`;
+                          notifBroker.push(
+                            enviarMensajeTeamMember(supabase, meta, vendedorMember, msgVendedorBroker, {
+                              tipoMensaje: 'alerta_lead',
+                              guardarPending: true,
+                              pendingKey: 'pending_alerta_lead'
+                            })
+                          );
+                        }
+                      }
 
-            // Para reacciones positivas, no responder para no ser invasivo
-            // Solo logueamos
-            console.log(`✅ Reacción positiva registrada: ${emoji}`);
-            return new Response('OK', { status: 200 });
-          }
-          // ═══ FIN MANEJO DE REACCIONES ═══
+                      if (notifBroker.length > 0) {
+                        await Promise.all(notifBroker);
+                      }
+                    }
 
-          // ═══ MANEJO DE VIDEO ═══
-          if (messageType === 'video') {
-            const videoSizeBytes = message.video?.file_size || 0;
-            const videoSizeMB = videoSizeBytes / (1024 * 1024);
-            console.log(`🎬 Video recibido (${videoSizeMB.toFixed(1)} MB)`);
+                    console.log('✅ Documento hipotecario procesado por BrokerService');
+                    return new Response('OK', { status: 200 });
+                  }
+                } catch (brokerErr) {
+                  console.warn('⚠️ Error en BrokerHipotecarioService:', brokerErr);
+                  // Fall through to document collection / desperfecto handler
+                }
+              }
 
-            if (videoSizeMB > 20) {
-              await meta.sendWhatsAppMessage(from,
-                '🎬 Recibimos tu video pero es muy pesado. ¿Puedes enviarnos fotos o un mensaje de texto? Así te podemos ayudar más rápido 📸');
-            } else {
-              await meta.sendWhatsAppMessage(from,
-                '🎬 ¡Gracias por el video! Trabajo mejor con mensajes de texto.\n\n¿Buscas casa en Zacatecas? Cuéntame qué necesitas y te muestro opciones 🏠');
-            }
-            return new Response('OK', { status: 200 });
-          }
-          // ═══ FIN MANEJO DE VIDEO ═══
-
-          // ═══ MANEJO DE CONTACTOS ═══
-          if (messageType === 'contacts') {
-            const contacts = message.contacts || [];
-            const contactInfo = contacts[0];
-            const contactName = contactInfo?.name?.formatted_name || contactInfo?.name?.first_name || '';
-            const contactPhone = contactInfo?.phones?.[0]?.phone || contactInfo?.phones?.[0]?.wa_id || '';
-            console.log(`👤 Contacto compartido: ${contactName} ${contactPhone}`);
-
-            // Si tiene teléfono válido, crear lead referido
-            if (contactPhone) {
+              // ═══ DOCUMENT COLLECTION - Detectar documentos de crédito por caption/filename ═══
               try {
-                const cleanContactPhone = contactPhone.replace(/\D/g, '');
-                if (cleanContactPhone.length >= 10) {
-                  // Verificar si ya existe
-                  const { data: existingLead } = await supabase.client
-                    .from('leads')
-                    .select('id, name')
-                    .or(`phone.eq.${cleanContactPhone},phone.like.%${cleanContactPhone.slice(-10)}`)
-                    .maybeSingle();
-
-                  if (!existingLead) {
-                    // Crear lead referido
-                    const cleanPhoneRef = from.replace(/\D/g, '');
-                    const { data: referrer } = await supabase.client
-                      .from('leads')
-                      .select('id, name')
-                      .or(`phone.eq.${cleanPhoneRef},phone.like.%${cleanPhoneRef.slice(-10)}`)
-                      .maybeSingle();
-
-                    const { error: refInsertErr } = await supabase.client.from('leads').insert({
-                      phone: cleanContactPhone,
-                      name: contactName || 'Referido',
-                      status: 'new',
-                      source: 'referral',
-                      notes: { referido_por: referrer?.name || from, referido_por_phone: from, created_via: 'shared_contact' }
-                    });
-                    if (refInsertErr) console.error('⚠️ Error creando lead referido:', refInsertErr.message);
-                    else console.log(`✅ Lead referido creado: ${contactName} (${cleanContactPhone})`);
+                const { DocumentCollectionService } = await import('./services/documentCollectionService');
+                const docService = new DocumentCollectionService(supabase);
+                const checklist = await docService.getChecklistStatus(lead.id);
+
+                if (checklist && checklist.missing.length > 0) {
+                  const docCaption = message.image?.caption || message.document?.caption || message.document?.filename || '';
+                  const docFilename = message.document?.filename || '';
+                  const docMimeType = message.image?.mime_type || message.document?.mime_type || '';
+                  const docType = docService.detectDocumentType(docCaption, docFilename, docMimeType);
+
+                  if (docType) {
+                    const docMediaId = message.image?.id || message.document?.id;
+                    const updated = await docService.markDocumentReceived(lead.id, docType, docMediaId);
+                    const { MORTGAGE_DOCUMENTS } = await import('./services/documentCollectionService');
+                    const docName = MORTGAGE_DOCUMENTS.find((d: any) => d.id === docType)?.name || docType;
+
+                    await meta.sendWhatsAppMessage(from, `✅ Recibí tu *${docName}*. Progreso: ${updated.completionPct}%`);
+
+                    if (updated.missing.length === 0) {
+                      await meta.sendWhatsAppMessage(from, '🎉 ¡Documentos completos! Tu asesor los revisará pronto.');
+
+                      // Notify asesor
+                      const leadNotesDoc = safeJsonParse(lead.notes);
+                      const asesorIdDoc = leadNotesDoc.credit_flow_context?.asesor_id || lead.assigned_advisor_id || lead.asesor_banco_id;
+                      if (asesorIdDoc) {
+                        const asesorDoc = await getEntityCache(supabase).getTeamMemberById(asesorIdDoc);
+                        if (asesorDoc) {
+                          await enviarMensajeTeamMember(supabase, meta, asesorDoc,
+                            `📋 *DOCUMENTOS COMPLETOS*\n\n👤 *${lead.name || 'Lead'}*\n📱 ${lead.phone ? formatPhoneForDisplay(lead.phone) : 'Sin tel'}\n\n¡Todos los documentos para crédito hipotecario recibidos!\nRevisa y continúa con el proceso.`,
+                            { tipoMensaje: 'alerta_lead', guardarPending: true, pendingKey: 'pending_alerta_lead' }
+                          );
+                        }
+                      }
+                    }
 
-                    await meta.sendWhatsAppMessage(from,
-                      `👤 ¡Registré a *${contactName || 'tu contacto'}*! Le escribiré para ofrecerle nuestras casas.\n\n¡Gracias por la referencia! 🏠`);
-                  } else {
-                    await meta.sendWhatsAppMessage(from,
-                      `👤 *${existingLead.name || contactName}* ya está registrado con nosotros. ¡Gracias por compartirlo!`);
+                    console.log(`📋 Document collection: ${docName} received for lead ${lead.id} (${updated.completionPct}%)`);
+                    return new Response('OK', { status: 200 });
                   }
-                } else {
-                  await meta.sendWhatsAppMessage(from,
-                    '👤 ¡Gracias por compartir el contacto! Si busca casa, dile que nos escriba por WhatsApp 🏠');
                 }
-              } catch (contactErr) {
-                console.error('Error procesando contacto compartido:', contactErr);
-                await meta.sendWhatsAppMessage(from,
-                  '👤 ¡Gracias por compartir el contacto! Si busca casa, con gusto lo atendemos 🏠');
+              } catch (docCollErr) {
+                console.warn('⚠️ Error en DocumentCollectionService:', docCollErr);
+                // Fall through to desperfecto handler
               }
-            } else {
-              await meta.sendWhatsAppMessage(from,
-                '👤 ¡Gracias por compartir el contacto! Si busca casa, dile que nos escriba por WhatsApp 🏠');
             }
-            return new Response('OK', { status: 200 });
+          } catch (imgErr) {
+            console.error('❌ Error procesando imagen:', imgErr);
           }
-          // ═══ FIN MANEJO DE CONTACTOS ═══
-
-          // ═══ MANEJO DE EMOJIS SOLOS ═══
-          const textoLimpio = text.trim();
-          // NOTA: Excluir strings puramente numéricos (0-10) para no interferir con respuestas NPS
-          const esPuroNumero = /^\d+$/.test(textoLimpio);
-          const esEmojiSolo = textoLimpio.length <= 4 && /^[\p{Emoji}\s]+$/u.test(textoLimpio) && !esPuroNumero;
-
-          if (esEmojiSolo && textoLimpio.length > 0) {
-            console.log(`😊 Emoji solo recibido: "${textoLimpio}"`);
-
-            // Interpretar emojis comunes
-            const emojisPositivos = ['👍', '👌', '✅', '🙌', '💪', '👏', '🔥', '❤️', '😍', '🥰', '😊', '🙂', '😃', '😄', '🤩', '💯'];
-            const emojisNegativos = ['👎', '❌', '😢', '😭', '😔', '😞', '🙁', '☹️'];
-            const emojisNeutrales = ['🤔', '😐', '😑', '🙄'];
-            const emojisCasa = ['🏠', '🏡', '🏘️', '🏢', '🏗️'];
-            const emojisDinero = ['💰', '💵', '💸', '🤑'];
-
-            let respuesta = '';
-
-            if (emojisPositivos.some(e => textoLimpio.includes(e))) {
-              respuesta = '¡Perfecto! 😊 Me da gusto que te interese.\n\n¿Te gustaría agendar una visita para conocer las casas en persona? Te puedo mostrar las mejores opciones este fin de semana 🏠';
-            } else if (emojisNegativos.some(e => textoLimpio.includes(e))) {
-              respuesta = 'Entiendo 😊 ¿Hay algo en específico que te preocupe o que pueda ayudarte a resolver?\n\nEstoy aquí para apoyarte en lo que necesites.';
-            } else if (emojisNeutrales.some(e => textoLimpio.includes(e))) {
-              respuesta = '¿Tienes alguna duda? 🤔 Con gusto te ayudo a resolver cualquier pregunta sobre nuestras casas o el proceso de compra.';
-            } else if (emojisCasa.some(e => textoLimpio.includes(e))) {
-              respuesta = '¡Veo que te interesan las casas! 🏠\n\nTenemos opciones desde $1.5 millones en Zacatecas. ¿Qué tipo de casa buscas? ¿De 2 o 3 recámaras?';
-            } else if (emojisDinero.some(e => textoLimpio.includes(e))) {
-              respuesta = '¡Hablemos de números! 💰\n\nTenemos casas desde $1.5M hasta $5M. Aceptamos INFONAVIT, FOVISSSTE y créditos bancarios.\n\n¿Cuál es tu presupuesto aproximado?';
-            } else {
-              // Emoji no reconocido - respuesta genérica amigable
-              respuesta = `¡Hola! 😊 Soy SARA de Grupo Santa Rita.\n\n¿En qué te puedo ayudar hoy? Tenemos casas increíbles en Zacatecas desde $1.5 millones 🏠`;
-            }
+        }
 
-            await meta.sendWhatsAppMessage(from, respuesta);
-            return new Response('OK', { status: 200 });
+        // ═══ DETECCIÓN DE FOTOS DE DESPERFECTOS (CLIENTES POST-ENTREGA) ═══
+        // caption ya definido arriba en línea 5839
+        const captionLower = caption.toLowerCase();
+
+        // Palabras clave que indican desperfectos/problemas
+        const palabrasDesperfecto = [
+          'humedad', 'húmedo', 'mojado', 'goteras', 'gotera', 'fuga', 'fugas',
+          'grieta', 'grietas', 'fisura', 'fisuras', 'cuarteado', 'cuarteadura',
+          'rotura', 'roto', 'rota', 'dañado', 'dañada', 'daño', 'desperfecto',
+          'mancha', 'manchas', 'moho', 'hongos', 'filtración', 'filtra',
+          'problema', 'defecto', 'mal estado', 'deterioro', 'deteriorado',
+          'pintura', 'descascarado', 'ampolla', 'burbuja',
+          'puerta', 'ventana', 'no cierra', 'no abre', 'atorado', 'atorada',
+          'piso', 'azulejo', 'loseta', 'levantado', 'quebrado',
+          'tubería', 'drenaje', 'atascado', 'tapado', 'no sirve',
+          'luz', 'eléctrico', 'apagón', 'corto', 'chispa',
+          'techo', 'plafón', 'caído', 'cayendo'
+        ];
+
+        const esReporteDesperfecto = palabrasDesperfecto.some(p => captionLower.includes(p));
+
+        // Buscar lead para verificar si es cliente post-entrega
+        const { data: leadImg } = await supabase.client
+          .from('leads')
+          .select('*, team_members!leads_assigned_to_fkey(phone, name)')
+          .or(`phone.eq.${cleanPhone},phone.like.%${cleanPhone.slice(-10)}`)
+          .maybeSingle();
+
+        const esClientePostEntrega = leadImg && ['delivered', 'sold', 'closed'].includes(leadImg.status);
+
+        // Si es cliente post-entrega y manda foto (con o sin caption de desperfecto)
+        if (esClientePostEntrega && (esReporteDesperfecto || !caption)) {
+          console.log(`🏠 Foto de posible desperfecto de cliente post-entrega: ${leadImg.name}`);
+
+          // Notificar al vendedor asignado
+          const vendedor = leadImg.team_members;
+          if (vendedor?.phone) {
+            const tipoProblema = esReporteDesperfecto ? `"${caption}"` : '(sin descripción)';
+            await meta.sendWhatsAppMessage(vendedor.phone,
+              `🚨 *REPORTE DE CLIENTE*\n\n` +
+              `👤 ${leadImg.name}\n` +
+              `📱 ${leadImg.phone ? formatPhoneForDisplay(leadImg.phone) : 'Sin tel'}\n` +
+              `🏠 Cliente entregado\n` +
+              `📸 Envió foto ${tipoProblema}\n\n` +
+              `Por favor contacta al cliente para dar seguimiento.`
+            );
+            console.log(`📤 Vendedor ${vendedor.name} notificado del reporte`);
           }
-          // ═══ FIN MANEJO DE EMOJIS SOLOS ═══
-
-          // ═══ DETECCIÓN DE LEADS CALIENTES, OBJECIONES Y RESPUESTAS A ENCUESTAS ═══
-          // Detectar señales de compra, objeciones y respuestas NPS ANTES de procesar el mensaje
-          // NOTA: No filtrar por longitud para capturar respuestas NPS cortas como "1", "10"
-          if (text) {
-            try {
-              const cleanPhoneHot = from.replace(/\D/g, '');
-              const { data: leadHot } = await supabase.client
-                .from('leads')
-                .select('id, name, phone, assigned_to, property_interest, notes, status')
-                .or(`phone.eq.${cleanPhoneHot},phone.like.%${cleanPhoneHot.slice(-10)}`)
-                .maybeSingle();
 
-              if (leadHot) {
-                // PRIMERO: Verificar si hay encuesta pendiente en tabla surveys (enviada desde CRM)
-                const pendingSurvey = await checkPendingSurveyResponse(supabase, meta, cleanPhoneHot, text, leadHot.name);
-                if (pendingSurvey) {
-                  console.log(`📋 Respuesta a encuesta CRM procesada para ${leadHot.name} - NO enviar respuesta genérica`);
-                  return new Response('OK', { status: 200 });
-                }
+          // También notificar al CEO
+          const CEO_PHONE = '5214922019052';
+          await meta.sendWhatsAppMessage(CEO_PHONE,
+            `🚨 *REPORTE POST-ENTREGA*\n\n` +
+            `👤 ${leadImg.name}\n` +
+            `📱 ${leadImg.phone ? formatPhoneForDisplay(leadImg.phone) : 'Sin tel'}\n` +
+            `📸 Envió foto: ${caption || '(sin descripción)'}\n` +
+            `👷 Vendedor: ${vendedor?.name || 'Sin asignar'}`
+          );
 
-                // SEGUNDO: Procesar respuestas a encuestas de CRONs (NPS, post-entrega, etc.)
-                // Estos pueden ser mensajes cortos como "1", "10", "si", "no"
-                const npsProcessed = leadHot.assigned_to ? await procesarRespuestaNPS(supabase, meta, leadHot, text) : false;
-                if (npsProcessed) {
-                  console.log(`📊 Respuesta NPS procesada para ${leadHot.name} - NO enviar respuesta genérica`);
-                  return new Response('OK', { status: 200 });
-                }
+          // Responder al cliente
+          await meta.sendWhatsAppMessage(from,
+            `📸 Recibí tu foto${caption ? ` sobre: "${caption}"` : ''}.\n\n` +
+            `Tu reporte ha sido registrado y ${vendedor?.name || 'nuestro equipo'} te contactará pronto para dar seguimiento.\n\n` +
+            `Si es algo urgente, puedes llamarnos directamente. ¡Gracias por reportarlo! 🏠`
+          );
 
-                const entregaProcessed = await procesarRespuestaEntrega(supabase, meta, leadHot, text);
-                if (entregaProcessed) {
-                  console.log(`🔑 Respuesta post-entrega procesada para ${leadHot.name} - NO enviar respuesta genérica`);
-                  return new Response('OK', { status: 200 });
-                }
+          // Guardar nota en el lead
+          const notaActual = leadImg.notes || [];
+          const nuevaNota = {
+            text: `📸 REPORTE CON FOTO: ${caption || 'Imagen sin descripción'}`,
+            author: 'SARA',
+            timestamp: new Date().toISOString(),
+            type: 'system'
+          };
+          await supabase.client
+            .from('leads')
+            .update({ notes: [...notaActual, nuevaNota] })
+            .eq('id', leadImg.id);
 
-                const satisfaccionProcessed = await procesarRespuestaSatisfaccionCasa(supabase, meta, leadHot, text);
-                if (satisfaccionProcessed) {
-                  console.log(`🏡 Respuesta satisfacción casa procesada para ${leadHot.name} - NO enviar respuesta genérica`);
-                  return new Response('OK', { status: 200 });
-                }
+          return new Response('OK', { status: 200 });
+        }
 
-                const mantenimientoProcessed = await procesarRespuestaMantenimiento(supabase, meta, leadHot, text);
-                if (mantenimientoProcessed) {
-                  console.log(`🔧 Respuesta mantenimiento procesada para ${leadHot.name} - NO enviar respuesta genérica`);
-                  return new Response('OK', { status: 200 });
-                }
+        // Si hay caption con palabras de desperfecto pero NO es cliente post-entrega
+        // (podría ser lead mostrando su casa actual)
+        if (esReporteDesperfecto && leadImg && !esClientePostEntrega) {
+          console.log(`📸 Lead ${leadImg.name} envió foto con descripción de problema (no es post-entrega)`);
+          await meta.sendWhatsAppMessage(from,
+            `📸 Veo que me compartes una foto. ¿Es de tu casa actual?\n\n` +
+            `Si estás buscando mudarte por esos problemas, ¡tengo casas nuevas desde $1.5M! 🏠\n\n` +
+            `¿Te gustaría conocer nuestros desarrollos?`
+          );
+          return new Response('OK', { status: 200 });
+        }
 
-                // TERCERO: Capturar feedback post-encuesta (mensaje de seguimiento después de calificar)
-                const feedbackProcessed = await procesarFeedbackEncuesta(supabase, meta, leadHot, text);
-                if (feedbackProcessed) {
-                  console.log(`💬 Feedback post-encuesta capturado para ${leadHot.name} - NO enviar respuesta genérica`);
-                  return new Response('OK', { status: 200 });
-                }
+        // ═══ RESPUESTA GENÉRICA PARA DOCUMENTOS (PDF/Word/etc) ═══
+        if (messageType === 'document') {
+          const docName = message.document?.filename || 'documento';
+          console.log(`📄 Documento genérico recibido: ${docName}`);
+          await meta.sendWhatsAppMessage(from,
+            `📄 Recibimos tu documento "${docName}".\n\n` +
+            `Un asesor lo revisará y te contactará. ¡Gracias!`);
+          return new Response('OK', { status: 200 });
+        }
 
-                // DESPUÉS: Detectar señales calientes y objeciones (solo para mensajes más largos)
-                if (text.length > 3) {
-                  // Detectar señales calientes
-                  const señalesCalientes = detectarSeñalesCalientes(text);
-                  if (señalesCalientes.length > 0) {
-                  console.log(`🔥 Señales calientes detectadas para ${leadHot.name}: ${señalesCalientes.map(s => s.tipo).join(', ')}`);
-                  await alertarLeadCaliente(supabase, meta, leadHot, text, señalesCalientes, { openaiApiKey: env.OPENAI_API_KEY });
-                }
+        // Respuesta genérica para otras imágenes
+        if (!text && !caption) {
+          await meta.sendWhatsAppMessage(from,
+            '📷 Recibí tu imagen. ¿En qué te puedo ayudar?\n\n' +
+            '🏠 Si buscas casa, tenemos opciones desde $1.5M\n' +
+            '💳 Si necesitas crédito, escríbeme "quiero crédito"');
+          return new Response('OK', { status: 200 });
+        }
+      }
+      // ═══ FIN MANEJO DE IMÁGENES ═══
 
-                // Detectar objeciones
-                const objeciones = detectarObjeciones(text);
-                if (objeciones.length > 0) {
-                  console.error(`⚠️ Objeciones detectadas para ${leadHot.name}: ${objeciones.map(o => o.tipo).join(', ')}`);
-                  await alertarObjecion(supabase, meta, leadHot, text, objeciones);
-                }
-                }
-              }
-            } catch (hotErr) {
-              console.error('Error en detección de leads calientes/objeciones:', hotErr);
-            }
-          }
-          // ═══ FIN DETECCIÓN DE LEADS CALIENTES Y OBJECIONES ═══
-
-          // ═══ CAROUSEL QUICK REPLY: Interceptar payloads carousel_ver_* y carousel_cita_* ═══
-          if (buttonPayloadRaw.startsWith('carousel_ver_') || buttonPayloadRaw.startsWith('carousel_cita_')) {
-            const isVerMas = buttonPayloadRaw.startsWith('carousel_ver_');
-            const slug = buttonPayloadRaw.replace(/^carousel_(ver|cita)_/, '');
-            // Reverse slug to development name: monte_verde → Monte Verde
-            const devName = slug.replace(/_/g, ' ').replace(/\b\w/g, (c: string) => c.toUpperCase());
-            console.log(`🎠 Carousel ${isVerMas ? 'VER MÁS' : 'AGENDAR CITA'}: slug="${slug}", desarrollo="${devName}"`);
-
-            if (isVerMas) {
-              // "Ver más" → trigger resource sending (video+GPS+brochure) for that development
-              text = `Quiero ver información de ${devName}`;
-            } else {
-              // "Agendar visita" → trigger appointment flow for that development
-              text = `Quiero agendar una visita a ${devName}`;
-            }
-          }
-          // ═══ FIN CAROUSEL QUICK REPLY ═══
+      // ═══ MANEJO DE AUDIOS/NOTAS DE VOZ ═══
+      if (messageType === 'audio') {
+        console.log(`🎤 Mensaje de audio recibido`);
 
-          // ═══ SLOT SCHEDULING REPLY: Handle slot_* list replies ═══
-          if (buttonPayloadRaw.startsWith('slot_')) {
-            try {
-              const { SlotSchedulingService } = await import('./services/slotSchedulingService');
-              const slotService = new SlotSchedulingService();
-              const slotParsed = slotService.parseSlotId(buttonPayloadRaw);
+        const audioId = message.audio?.id;
+        const audioMimeType = message.audio?.mime_type || 'audio/ogg';
 
-              if (slotParsed) {
-                // Look up the lead
-                const { data: slotLead } = await supabase.client
-                  .from('leads')
-                  .select('id, name, phone, status, assigned_to, property_interest, notes')
-                  .eq('phone', from)
-                  .single();
-
-                if (slotLead) {
-                  const { AppointmentSchedulingService } = await import('./services/appointmentSchedulingService');
-                  const { CalendarService: CalSvc } = await import('./services/calendar');
-                  const slotCalendar = new CalSvc(
-                    tenant.config.googleServiceAccountEmail || env.GOOGLE_SERVICE_ACCOUNT_EMAIL,
-                    tenant.config.googlePrivateKey || env.GOOGLE_PRIVATE_KEY,
-                    tenant.config.googleCalendarId || env.GOOGLE_CALENDAR_ID
-                  );
-                  const appointmentService = new AppointmentSchedulingService(supabase, slotCalendar);
-
-                  // Get team members for vendedor assignment
-                  const { data: slotTeamMembers } = await supabase.client
-                    .from('team_members')
-                    .select('id, name, phone, role, active')
-                    .eq('active', true);
-
-                  const vendedorSlot = slotTeamMembers?.find((t: any) => t.id === slotLead.assigned_to) ||
-                                   slotTeamMembers?.find((t: any) => t.role === 'vendedor' && t.active);
-
-                  const desarrollo = slotLead.property_interest || 'Por definir';
-
-                  // Parse slot time: "10:00" → hora=10, ampm=am; "14:00" → hora=2, ampm=pm
-                  const slotHourNum = parseInt(slotParsed.time.split(':')[0]);
-                  const slotAmpm = slotHourNum >= 12 ? 'pm' : 'am';
-                  const slotHour12 = slotHourNum > 12 ? slotHourNum - 12 : (slotHourNum === 0 ? 12 : slotHourNum);
-                  const slotMinutes = slotParsed.time.split(':')[1] || '00';
-
-                  const citaResult = await appointmentService.agendarCitaConSeleccion(
-                    slotLead,
-                    slotParsed.date,  // ISO date string
-                    String(slotHour12),
-                    slotAmpm,
-                    vendedorSlot || { id: '', name: 'Sin asignar', role: 'vendedor' },
-                    slotMinutes,
-                    desarrollo
-                  );
+        if (audioId && env.OPENAI_API_KEY) {
+          try {
+            const audioService = createAudioTranscription(env.OPENAI_API_KEY, env.META_ACCESS_TOKEN);
+            const transcription = await audioService.processWhatsAppAudio({
+              mediaId: audioId,
+              mimeType: audioMimeType
+            });
 
-                  if (citaResult.success) {
-                    await meta.sendWhatsAppMessage(from,
-                      `✅ *¡Cita agendada!*\n\n` +
-                      `📅 ${citaResult.fecha}\n` +
-                      `🕐 ${citaResult.hora}\n` +
-                      `🏠 ${desarrollo}\n\n` +
-                      `Te esperamos. Si necesitas cambiar algo, escribe *reagendar* o *cancelar cita*.`
-                    );
-                  } else {
-                    await meta.sendWhatsAppMessage(from,
-                      citaResult.error || '⚠️ No pude agendar la cita. ¿Podrías darme la fecha y hora que prefieres?'
-                    );
-                  }
+            if (transcription.success && transcription.text) {
+              console.log(`✅ Audio transcrito: "${transcription.text.substring(0, 100)}..."`);
 
-                  // Clear pending_slot_selection
-                  const slotNotes = typeof slotLead.notes === 'object' ? slotLead.notes : {};
-                  delete slotNotes.pending_slot_selection;
-                  await supabase.client.from('leads').update({ notes: slotNotes }).eq('id', slotLead.id);
+              // Marcar en el lead que el último mensaje fue audio (para TTS en respuesta)
+              const cleanPhoneAudio = from.replace(/\D/g, '');
+              const { data: leadForAudio } = await supabase.client
+                .from('leads')
+                .select('id, notes')
+                .or(`phone.eq.${cleanPhoneAudio},phone.like.%${cleanPhoneAudio.slice(-10)}`)
+                .maybeSingle();
 
-                  return new Response('OK', { status: 200 });
-                }
+              if (leadForAudio) {
+                const notesAudio = typeof leadForAudio.notes === 'object' ? leadForAudio.notes : {};
+                await supabase.client
+                  .from('leads')
+                  .update({ notes: { ...notesAudio, last_message_was_audio: true } })
+                  .eq('id', leadForAudio.id);
+                console.log('🎤 Marcado: último mensaje fue audio (TTS activado para respuesta)');
               }
-            } catch (slotErr) {
-              console.error('Error processing slot selection:', slotErr);
-              // Fall through to normal message handling
-            }
-          }
-          // ═══ FIN SLOT SCHEDULING REPLY ═══
-
-          // ═══ RECURSO QUICK REPLY: Handle recurso_gps_*, recurso_brochure_*, recurso_video_*, recurso_3d_* ═══
-          if (buttonPayloadRaw.startsWith('recurso_')) {
-            const recursoMatch = buttonPayloadRaw.match(/^recurso_(gps|brochure|video|3d)_(.+)$/);
-            if (recursoMatch) {
-              const recursoType = recursoMatch[1]; // gps, brochure, video, 3d
-              const slug = recursoMatch[2]; // monte_verde, andes, etc.
-              const devName = slug.replace(/_/g, ' ').replace(/\b\w/g, (c: string) => c.toUpperCase());
-              console.log(`🖼️ Recurso button tap: tipo="${recursoType}", slug="${slug}", desarrollo="${devName}"`);
 
-              try {
-                // Look up property in DB by development name
-                const slugNorm = slug.replace(/_/g, ' ');
-                const { data: recursoProps } = await supabase.client
-                  .from('properties')
-                  .select('development, name, gps_link, youtube_link, matterport_link, brochure_urls')
-                  .ilike('development', `%${slugNorm}%`)
-                  .limit(5);
-                const propMatch = (recursoProps || [])[0];
-
-                if (propMatch) {
-                  let recursoEnviado = false;
-                  if (recursoType === 'gps' && propMatch.gps_link) {
-                    await meta.sendCTAButton(from,
-                      `📍 Ubicación de *${devName}*`,
-                      'Abrir en Maps 📍',
-                      propMatch.gps_link
-                    );
-                    recursoEnviado = true;
-                    console.log(`✅ GPS CTA enviado para ${devName}`);
-                  } else if (recursoType === 'brochure') {
-                    const brochureUrl = Array.isArray(propMatch.brochure_urls)
-                      ? propMatch.brochure_urls[0]
-                      : (typeof propMatch.brochure_urls === 'string' ? propMatch.brochure_urls : null);
-                    if (brochureUrl) {
-                      if (brochureUrl.includes('.html') || brochureUrl.includes('pages.dev')) {
-                        await meta.sendCTAButton(from,
-                          `📋 Brochure de *${devName}*`,
-                          'Ver brochure 📋',
-                          brochureUrl
-                        );
-                      } else {
-                        // PDF brochure → send as document
-                        const filename = `Brochure_${devName.replace(/\s+/g, '_')}.pdf`;
-                        await meta.sendWhatsAppDocument(from, brochureUrl, filename, `📋 Brochure ${devName}`);
-                      }
-                      recursoEnviado = true;
-                      console.log(`✅ Brochure enviado para ${devName}`);
-                    } else {
-                      // Fallback brochure URL
-                      const fallbackUrl = `https://sara-backend.edson-633.workers.dev/brochure/${slug.replace(/_/g, '-').replace(/\.html$/, '')}`;
-                      await meta.sendCTAButton(from,
-                        `📋 Brochure de *${devName}*`,
-                        'Ver brochure 📋',
-                        fallbackUrl
-                      );
-                      recursoEnviado = true;
-                      console.log(`✅ Brochure fallback enviado para ${devName}`);
-                    }
-                  } else if (recursoType === 'video' && propMatch.youtube_link) {
-                    await meta.sendCTAButton(from,
-                      `🎬 Video de *${devName}*`,
-                      'Ver video 🎬',
-                      propMatch.youtube_link
-                    );
-                    recursoEnviado = true;
-                    console.log(`✅ Video CTA enviado para ${devName}`);
-                  } else if (recursoType === '3d' && propMatch.matterport_link) {
-                    await meta.sendCTAButton(from,
-                      `🏠 Recorrido 3D de *${devName}*`,
-                      'Ver recorrido 🏠',
-                      propMatch.matterport_link
-                    );
-                    recursoEnviado = true;
-                    console.log(`✅ Matterport CTA enviado para ${devName}`);
-                  } else {
-                    // Resource not available for this development
-                    await meta.sendWhatsAppMessage(from,
-                      `Lo siento, ese recurso no está disponible para *${devName}*. ¿Te puedo ayudar con algo más?`);
-                    console.log(`⚠️ Recurso "${recursoType}" no disponible para ${devName}`);
-                  }
+              // Procesar el texto transcrito como si fuera un mensaje normal
+              const handler = new WhatsAppHandler(supabase, claude, meta as any, calendar, meta, tenant, (p) => ctx.waitUntil(p));
+              await handler.handleIncomingMessage(`whatsapp:+${from}`, transcription.text, env);
 
-                  // Follow-up de venta después de enviar recurso
-                  if (recursoEnviado) {
-                    await new Promise(r => setTimeout(r, 1000));
-                    const followUps: Record<string, string> = {
-                      'gps': `¿Te gustaría visitar *${devName}*? Puedo agendarte una visita este fin de semana 🏡`,
-                      'video': `¿Qué te pareció? Si quieres conocerlo en persona, te agendo una visita. ¿Sábado o domingo? 📅`,
-                      '3d': `¿Te gustó el recorrido? Nada como verlo en persona. ¿Qué día te funciona para visitarlo? 🏠`,
-                      'brochure': `Ahí tienes todos los detalles. ¿Te gustaría agendar una visita para conocer *${devName}*? 📅`,
-                    };
-                    await meta.sendWhatsAppMessage(from, followUps[recursoType] || `¿Te gustaría visitar *${devName}*? 🏡`);
-                    console.log(`✅ Follow-up de venta enviado después de recurso ${recursoType}`);
-                  }
-                } else {
-                  console.error(`⚠️ No se encontró propiedad para slug: ${slug}`);
-                  await meta.sendWhatsAppMessage(from,
-                    `No encontré información de ese desarrollo. ¿Cuál te interesa conocer?`);
-                }
-              } catch (recursoErr) {
-                console.error('❌ Error procesando recurso button:', recursoErr);
-                // Fall through to normal AI processing
-              }
+              console.log('✅ Audio procesado correctamente');
+              return new Response('OK', { status: 200 });
+            } else {
+              // Si falla la transcripción, responder amigablemente
+              console.log(`⚠️ No se pudo transcribir audio: ${transcription.error}`);
+              await meta.sendWhatsAppMessage(from,
+                '🎤 Recibí tu nota de voz, pero no pude escucharla bien. ¿Podrías escribirme tu mensaje? Así te ayudo mejor 😊');
               return new Response('OK', { status: 200 });
             }
+          } catch (audioErr) {
+            console.error('❌ Error procesando audio:', audioErr);
+            await meta.sendWhatsAppMessage(from,
+              '🎤 Recibí tu audio. Por el momento prefiero mensajes de texto para atenderte mejor. ¿En qué te puedo ayudar? 🏠');
+            return new Response('OK', { status: 200 });
           }
-          // ═══ FIN RECURSO QUICK REPLY ═══
-
-          // ═══ LIST MENU QUICK REPLY: Rewrite cmd_* payloads to recognizable commands ═══
-          if (buttonPayloadRaw.startsWith('cmd_')) {
-            const cmdMap: Record<string, string> = {
-              'cmd_mis_leads': 'mis leads',
-              'cmd_citas': 'citas',
-              'cmd_hot': 'hot',
-              'cmd_pendientes': 'pendientes'
-            };
-
-            if (cmdMap[buttonPayloadRaw]) {
-              text = cmdMap[buttonPayloadRaw];
-              console.log(`📱 List menu cmd rewrite: "${buttonPayloadRaw}" → "${text}"`);
-            } else if (buttonPayloadRaw.startsWith('cmd_oferta_')) {
-              const leadSlug = buttonPayloadRaw.replace('cmd_oferta_', '').replace(/_/g, ' ');
-              text = `oferta ${leadSlug}`;
-              console.log(`📱 List menu oferta rewrite: "${buttonPayloadRaw}" → "${text}"`);
-            } else if (buttonPayloadRaw.startsWith('cmd_quien_es_')) {
-              const nameSlug = buttonPayloadRaw.replace('cmd_quien_es_', '').replace(/_/g, ' ');
-              text = `quien es ${nameSlug}`;
-              console.log(`📱 List menu quien_es rewrite: "${buttonPayloadRaw}" → "${text}"`);
-            } else if (buttonPayloadRaw.startsWith('btn_credito_')) {
-              const tipoCredito = buttonPayloadRaw.replace('btn_credito_', '');
-              const creditoMap: Record<string, string> = {
-                'infonavit': 'Quiero información sobre crédito INFONAVIT',
-                'bancario': 'Quiero información sobre crédito bancario',
-                'cofinavit': 'Quiero información sobre crédito Cofinavit',
-                'fovissste': 'Quiero información sobre crédito FOVISSSTE'
-              };
-              text = creditoMap[tipoCredito] || `Quiero crédito ${tipoCredito}`;
-              console.log(`📱 List menu crédito rewrite: "${buttonPayloadRaw}" → "${text}"`);
-            }
-          }
-          // ═══ FIN LIST MENU QUICK REPLY ═══
-
-          await handler.handleIncomingMessage(`whatsapp:+${from}`, text, env);
-
-          console.log('✅ Mensaje procesado correctamente');
-
-          // Cancelar follow-ups cuando el lead responde
-          const followupService = new FollowupService(supabase);
-          await followupService.cancelarPorRespuesta('', from);
         } else {
-          console.error('⚠️ No hay mensajes en el webhook (puede ser status update)');
+          // No hay API key de OpenAI - respuesta genérica
+          await meta.sendWhatsAppMessage(from,
+            '🎤 Recibí tu nota de voz. Por el momento trabajo mejor con mensajes de texto. ¿Podrías escribirme en qué te puedo ayudar? 🏠');
+          return new Response('OK', { status: 200 });
         }
+      }
+      // ═══ FIN MANEJO DE AUDIOS ═══
 
+      // ═══ MANEJO DE STICKERS Y GIFS ═══
+      if (messageType === 'sticker') {
+        console.log(`😄 Sticker recibido - ignorando silenciosamente`);
         return new Response('OK', { status: 200 });
-      } catch (error) {
-        console.error('❌ Meta Webhook Error:', error);
+      }
+      // ═══ FIN MANEJO DE STICKERS ═══
 
-        // RECOVERY: Si el procesamiento falló, eliminar la marca KV para que
-        // el retry de Meta NO sea rechazado como duplicado (Lead Fantasma fix)
-        if (kvDedupKey) {
-          try {
-            await env.SARA_CACHE.delete(kvDedupKey);
-            console.log(`🔄 KV dedup cleared for retry: ${kvDedupKey}`);
-          } catch (kvCleanErr) {
-            console.warn('KV cleanup failed (non-critical):', kvCleanErr);
+      // ═══ MANEJO DE UBICACIÓN ═══
+      if (messageType === 'location') {
+        const lat = message.location?.latitude;
+        const lon = message.location?.longitude;
+        const locName = message.location?.name || '';
+        const locAddress = message.location?.address || '';
+        console.log(`📍 Ubicación recibida: lat=${lat}, lon=${lon}, name=${locName}`);
+
+        // Guardar ubicación en lead.notes
+        try {
+          const cleanPhoneLoc = from.replace(/\D/g, '');
+          const { data: leadLoc } = await supabase.client
+            .from('leads')
+            .select('id, notes')
+            .or(`phone.eq.${cleanPhoneLoc},phone.like.%${cleanPhoneLoc.slice(-10)}`)
+            .maybeSingle();
+          if (leadLoc) {
+            const locNotes = typeof leadLoc.notes === 'object' && leadLoc.notes ? leadLoc.notes : {};
+            await supabase.client.from('leads').update({
+              notes: { ...locNotes, location: { lat, lon, name: locName, address: locAddress, saved_at: new Date().toISOString() } }
+            }).eq('id', leadLoc.id);
+            console.log(`📍 Ubicación guardada en lead ${leadLoc.id}`);
           }
+        } catch (locErr) {
+          console.error('Error guardando ubicación:', locErr);
         }
 
-        // Persist to error_logs + real-time alerting
-        ctx.waitUntil(logErrorToDB(supabase, 'webhook_error', error instanceof Error ? error.message : String(error), {
-          severity: 'critical',
-          source: 'webhook:meta',
-          stack: error instanceof Error ? error.stack : undefined,
-          context: { from: from || 'unknown', messageId: messageId || 'unknown' }
-        }));
-        ctx.waitUntil(alertOnCriticalError(supabase, meta, env, 'webhook_error', error instanceof Error ? error.message : String(error), 'webhook:meta'));
+        // ═══ LOCATION SERVICE: Verificar si está en zona Zacatecas ═══
+        if (lat && lon) {
+          const locationService = new LocationService();
+          if (!locationService.isInZacatecasArea(lat, lon)) {
+            console.log(`📍 Ubicación fuera de zona Zacatecas (${lat}, ${lon})`);
+            // Still show developments but mention they're far
+          }
+        }
 
-        return new Response('OK', { status: 200 });
-      }
-    }
+        // ═══ HAVERSINE: Calcular distancia a cada desarrollo ═══
+        const GPS_DESARROLLOS: Array<{ name: string; lat: number; lon: number; zona: string }> = [
+          { name: 'Monte Verde', lat: 22.7685, lon: -102.5557, zona: 'Colinas del Padre' },
+          { name: 'Los Encinos', lat: 22.7690, lon: -102.5560, zona: 'Colinas del Padre' },
+          { name: 'Miravalle', lat: 22.7695, lon: -102.5555, zona: 'Colinas del Padre' },
+          { name: 'Paseo Colorines', lat: 22.7680, lon: -102.5550, zona: 'Colinas del Padre' },
+          { name: 'Andes', lat: 22.7650, lon: -102.5100, zona: 'Guadalupe' },
+          { name: 'Distrito Falco', lat: 22.7700, lon: -102.5200, zona: 'Guadalupe' },
+          { name: 'Villa Campelo', lat: 22.7600, lon: -102.5150, zona: 'Citadella del Nogal' },
+          { name: 'Villa Galiano', lat: 22.7605, lon: -102.5155, zona: 'Citadella del Nogal' },
+        ];
+
+        if (lat && lon) {
+          // Haversine formula
+          const toRad = (deg: number) => deg * Math.PI / 180;
+          const haversine = (lat1: number, lon1: number, lat2: number, lon2: number): number => {
+            const R = 6371; // km
+            const dLat = toRad(lat2 - lat1);
+            const dLon = toRad(lon2 - lon1);
+            const a = Math.sin(dLat / 2) ** 2 + Math.cos(toRad(lat1)) * Math.cos(toRad(lat2)) * Math.sin(dLon / 2) ** 2;
+            return R * 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1 - a));
+          };
 
-    // ═══════════════════════════════════════════════════════════════
-    // Webhook Facebook Lead Ads - Recibir leads de Meta Ads
-    // ═══════════════════════════════════════════════════════════════
-    
-    if (url.pathname === '/webhook/facebook-leads' && request.method === 'GET') {
-      const mode = url.searchParams.get('hub.mode');
-      const token = url.searchParams.get('hub.verify_token');
-      const challenge = url.searchParams.get('hub.challenge');
-      
-      if (mode === 'subscribe' && token === 'sara_fb_leads_token') {
-        console.log('✅ Facebook Leads webhook verified');
-        return new Response(challenge, { status: 200 });
-      }
-      return new Response('Forbidden', { status: 403 });
-    }
+          const distancias = GPS_DESARROLLOS.map(d => ({
+            ...d,
+            distancia: haversine(lat, lon, d.lat, d.lon)
+          })).sort((a, b) => a.distancia - b.distancia);
+
+          // Top 3 más cercanos con precios dinámicos
+          const { data: locProps } = await supabase.client.from('properties').select('development_name, name, price_equipped, price, gps_link').limit(50);
+          const allProps = locProps || [];
+          const top3 = distancias.slice(0, 3);
+
+          let respuesta = `📍 ¡Gracias por tu ubicación! Los desarrollos más cercanos a ti son:\n`;
+          for (const dev of top3) {
+            const distKm = dev.distancia.toFixed(1);
+            const precio = AIConversationService.precioMinDesarrollo(allProps, dev.name);
+            respuesta += `\n🏘️ *${dev.name}* (${dev.zona})\n   📏 ~${distKm} km — Desde ${precio}\n`;
+          }
+          respuesta += `\n¿Cuál te gustaría visitar?`;
 
-    if (url.pathname === '/webhook/facebook-leads' && request.method === 'POST') {
-      try {
-        // Leer body como texto para verificar firma
-        const bodyText = await request.text();
-
-        // Verificar firma si META_WEBHOOK_SECRET está configurado
-        if (env.META_WEBHOOK_SECRET) {
-          const isValid = await verifyMetaSignature(request, bodyText, env.META_WEBHOOK_SECRET);
-          if (!isValid) {
-            console.error('🚫 FACEBOOK LEADS: Firma inválida - posible spoofing');
-            return new Response('Invalid signature', { status: 401 });
+          await meta.sendWhatsAppMessage(from, respuesta);
+
+          // CTA button del más cercano (si tiene GPS link)
+          const nearest = top3[0];
+          const nearestProp = allProps.find(p =>
+            (p.development_name || '').toLowerCase().includes(nearest.name.toLowerCase()) && p.gps_link
+          );
+          if (nearestProp?.gps_link) {
+            await new Promise(r => setTimeout(r, 300));
+            try {
+              await meta.sendCTAButton(from,
+                `📍 ${nearest.name} es el más cercano a ti (~${nearest.distancia.toFixed(1)} km)`,
+                'Ver ubicación 📍',
+                nearestProp.gps_link
+              );
+            } catch (ctaErr: any) {
+              console.error(`❌ CTA location falló: ${ctaErr.message?.slice(0, 200)}`);
+            }
           }
-          console.log('✅ FACEBOOK LEADS: Firma verificada');
         } else {
-          console.warn('⚠️ META_WEBHOOK_SECRET no configurado - webhooks sin verificar');
+          // Sin coordenadas válidas — fallback con precios dinámicos
+          const { data: fallbackProps } = await supabase.client.from('properties').select('development_name, name, price_equipped, price').limit(50);
+          const fbProps = fallbackProps || [];
+          const listaDesarrollos = AIConversationService.listaBulletDesarrollos(fbProps);
+          await meta.sendWhatsAppMessage(from,
+            `📍 ¡Gracias por tu ubicación!\n\nNuestros desarrollos en *Zacatecas*:\n\n${listaDesarrollos}\n\n¿Cuál te gustaría conocer?`);
         }
+        return new Response('OK', { status: 200 });
+      }
+      // ═══ FIN MANEJO DE UBICACIÓN ═══
+
+      // ═══ MANEJO DE REACCIONES ═══
+      if (messageType === 'reaction') {
+        console.log(`👍 Reacción recibida: ${message.reaction?.emoji}`);
 
-        const body = safeJsonParse(bodyText, null);
-        if (!body) {
-          console.error('❌ FACEBOOK LEADS: JSON inválido, bodyText:', bodyText?.substring(0, 200));
+        const emoji = message.reaction?.emoji;
+
+        // Ignorar reacciones negativas silenciosamente
+        if (emoji === '👎' || emoji === '😡' || emoji === '😠') {
+          console.log('⚠️ Reacción negativa - no responder');
           return new Response('OK', { status: 200 });
         }
-        console.log('🔥 Facebook Lead recibido:', JSON.stringify(body));
 
-        const entry = body?.entry?.[0];
-        const changes = entry?.changes?.[0];
+        // Para reacciones positivas, no responder para no ser invasivo
+        // Solo logueamos
+        console.log(`✅ Reacción positiva registrada: ${emoji}`);
+        return new Response('OK', { status: 200 });
+      }
+      // ═══ FIN MANEJO DE REACCIONES ═══
 
-        // Facebook Lead Ads envía el campo "leadgen_id"
-        if (changes?.field === 'leadgen' && changes?.value?.leadgen_id) {
-          const leadgenId = changes.value.leadgen_id;
-          const formId = changes.value.form_id;
-          const pageId = changes.value.page_id;
-          const createdTime = changes.value.created_time;
+      // ═══ MANEJO DE VIDEO ═══
+      if (messageType === 'video') {
+        const videoSizeBytes = message.video?.file_size || 0;
+        const videoSizeMB = videoSizeBytes / (1024 * 1024);
+        console.log(`🎬 Video recibido (${videoSizeMB.toFixed(1)} MB)`);
 
-          // KV dedup — prevent duplicate processing of same Facebook lead
+        if (videoSizeMB > 20) {
+          await meta.sendWhatsAppMessage(from,
+            '🎬 Recibimos tu video pero es muy pesado. ¿Puedes enviarnos fotos o un mensaje de texto? Así te podemos ayudar más rápido 📸');
+        } else {
+          await meta.sendWhatsAppMessage(from,
+            '🎬 ¡Gracias por el video! Trabajo mejor con mensajes de texto.\n\n¿Buscas casa en Zacatecas? Cuéntame qué necesitas y te muestro opciones 🏠');
+        }
+        return new Response('OK', { status: 200 });
+      }
+      // ═══ FIN MANEJO DE VIDEO ═══
+
+      // ═══ MANEJO DE CONTACTOS ═══
+      if (messageType === 'contacts') {
+        const contacts = message.contacts || [];
+        const contactInfo = contacts[0];
+        const contactName = contactInfo?.name?.formatted_name || contactInfo?.name?.first_name || '';
+        const contactPhone = contactInfo?.phones?.[0]?.phone || contactInfo?.phones?.[0]?.wa_id || '';
+        console.log(`👤 Contacto compartido: ${contactName} ${contactPhone}`);
+
+        // Si tiene teléfono válido, crear lead referido
+        if (contactPhone) {
           try {
-            const fbDedupKey = `fblead:${leadgenId}`;
-            if (await env.SARA_CACHE.get(fbDedupKey)) {
-              console.log(`⏭️ Facebook lead ya procesado: ${leadgenId}`);
-              return new Response('OK', { status: 200 });
-            }
-            await env.SARA_CACHE.put(fbDedupKey, '1', { expirationTtl: 86400 });
-          } catch (_kvErr) { /* fallback: DB phone dedup below */ }
+            const cleanContactPhone = contactPhone.replace(/\D/g, '');
+            if (cleanContactPhone.length >= 10) {
+              // Verificar si ya existe
+              const { data: existingLead } = await supabase.client
+                .from('leads')
+                .select('id, name')
+                .or(`phone.eq.${cleanContactPhone},phone.like.%${cleanContactPhone.slice(-10)}`)
+                .maybeSingle();
 
-          console.log(`🎯 Nuevo lead de Facebook: ${leadgenId}`);
+              if (!existingLead) {
+                // Crear lead referido
+                const cleanPhoneRef = from.replace(/\D/g, '');
+                const { data: referrer } = await supabase.client
+                  .from('leads')
+                  .select('id, name')
+                  .or(`phone.eq.${cleanPhoneRef},phone.like.%${cleanPhoneRef.slice(-10)}`)
+                  .maybeSingle();
 
-          // Obtener datos reales del lead desde Graph API
-          let leadName = `Facebook Lead ${leadgenId.slice(-6)}`;
-          let leadPhone = '';
-          let leadEmail = '';
-          let leadNotes = '';
+                const { error: refInsertErr } = await supabase.client.from('leads').insert({
+                  phone: cleanContactPhone,
+                  name: contactName || 'Referido',
+                  status: 'new',
+                  source: 'referral',
+                  notes: { referido_por: referrer?.name || from, referido_por_phone: from, created_via: 'shared_contact' }
+                });
+                if (refInsertErr) console.error('⚠️ Error creando lead referido:', refInsertErr.message);
+                else console.log(`✅ Lead referido creado: ${contactName} (${cleanContactPhone})`);
 
-          try {
-            const fbCtrl = new AbortController();
-            const fbTimer = setTimeout(() => fbCtrl.abort(), 10_000);
-            const graphResponse = await fetch(
-              `https://graph.facebook.com/v18.0/${leadgenId}?access_token=${env.META_ACCESS_TOKEN}`,
-              { signal: fbCtrl.signal }
-            );
-            clearTimeout(fbTimer);
-
-            if (graphResponse.ok) {
-              const leadData = await graphResponse.json() as any;
-              console.log('📋 Datos del lead:', JSON.stringify(leadData));
-
-              // Parsear field_data del formulario
-              if (leadData.field_data) {
-                for (const field of leadData.field_data) {
-                  const fieldName = field.name?.toLowerCase() || '';
-                  const fieldValue = field.values?.[0] || '';
-
-                  if (fieldName.includes('name') || fieldName.includes('nombre')) {
-                    leadName = fieldValue || leadName;
-                  } else if (fieldName.includes('phone') || fieldName.includes('tel') || fieldName.includes('whatsapp') || fieldName.includes('celular')) {
-                    leadPhone = fieldValue.replace(/\D/g, ''); // Solo números
-                    // Agregar 521 si es número mexicano de 10 dígitos
-                    if (leadPhone.length === 10) {
-                      leadPhone = '521' + leadPhone;
-                    }
-                  } else if (fieldName.includes('email') || fieldName.includes('correo')) {
-                    leadEmail = fieldValue;
-                  } else {
-                    // Otros campos van a notas
-                    leadNotes += `${field.name}: ${fieldValue}\n`;
-                  }
-                }
+                await meta.sendWhatsAppMessage(from,
+                  `👤 ¡Registré a *${contactName || 'tu contacto'}*! Le escribiré para ofrecerle nuestras casas.\n\n¡Gracias por la referencia! 🏠`);
+              } else {
+                await meta.sendWhatsAppMessage(from,
+                  `👤 *${existingLead.name || contactName}* ya está registrado con nosotros. ¡Gracias por compartirlo!`);
               }
             } else {
-              console.error('❌ Error obteniendo datos de Graph API:', await graphResponse.text());
+              await meta.sendWhatsAppMessage(from,
+                '👤 ¡Gracias por compartir el contacto! Si busca casa, dile que nos escriba por WhatsApp 🏠');
             }
-          } catch (graphError) {
-            console.error('❌ Error llamando Graph API:', graphError);
-          }
-
-          // Verificar si el lead ya existe (por teléfono o leadgen_id)
-          let existingLead = null;
-          if (leadPhone) {
-            const { data: byPhone } = await supabase.client
-              .from('leads')
-              .select('*')
-              .eq('phone', leadPhone)
-              .maybeSingle();
-            existingLead = byPhone;
-          }
-
-          if (existingLead) {
-            console.error(`⚠️ Lead ya existe: ${existingLead.id}`);
-            // Actualizar con datos de Facebook si es más reciente
-            const { error: fbUpdateErr } = await supabase.client.from('leads').update({
-              source: 'facebook_ads',
-              notes: `${existingLead.notes || ''}\n---\nActualizado desde Facebook Lead ${leadgenId} el ${new Date().toLocaleString('es-MX')}`
-            }).eq('id', existingLead.id);
-            if (fbUpdateErr) console.error('⚠️ Error actualizando lead de Facebook:', fbUpdateErr.message);
-
-            return new Response('OK', { status: 200 });
+          } catch (contactErr) {
+            console.error('Error procesando contacto compartido:', contactErr);
+            await meta.sendWhatsAppMessage(from,
+              '👤 ¡Gracias por compartir el contacto! Si busca casa, con gusto lo atendemos 🏠');
           }
+        } else {
+          await meta.sendWhatsAppMessage(from,
+            '👤 ¡Gracias por compartir el contacto! Si busca casa, dile que nos escriba por WhatsApp 🏠');
+        }
+        return new Response('OK', { status: 200 });
+      }
+      // ═══ FIN MANEJO DE CONTACTOS ═══
+
+      // ═══ MANEJO DE EMOJIS SOLOS ═══
+      const textoLimpio = text.trim();
+      // NOTA: Excluir strings puramente numéricos (0-10) para no interferir con respuestas NPS
+      const esPuroNumero = /^\d+$/.test(textoLimpio);
+      const esEmojiSolo = textoLimpio.length <= 4 && /^[\p{Emoji}\s]+$/u.test(textoLimpio) && !esPuroNumero;
+
+      if (esEmojiSolo && textoLimpio.length > 0) {
+        console.log(`😊 Emoji solo recibido: "${textoLimpio}"`);
+
+        // Interpretar emojis comunes
+        const emojisPositivos = ['👍', '👌', '✅', '🙌', '💪', '👏', '🔥', '❤️', '😍', '🥰', '😊', '🙂', '😃', '😄', '🤩', '💯'];
+        const emojisNegativos = ['👎', '❌', '😢', '😭', '😔', '😞', '🙁', '☹️'];
+        const emojisNeutrales = ['🤔', '😐', '😑', '🙄'];
+        const emojisCasa = ['🏠', '🏡', '🏘️', '🏢', '🏗️'];
+        const emojisDinero = ['💰', '💵', '💸', '🤑'];
+
+        let respuesta = '';
+
+        if (emojisPositivos.some(e => textoLimpio.includes(e))) {
+          respuesta = '¡Perfecto! 😊 Me da gusto que te interese.\n\n¿Te gustaría agendar una visita para conocer las casas en persona? Te puedo mostrar las mejores opciones este fin de semana 🏠';
+        } else if (emojisNegativos.some(e => textoLimpio.includes(e))) {
+          respuesta = 'Entiendo 😊 ¿Hay algo en específico que te preocupe o que pueda ayudarte a resolver?\n\nEstoy aquí para apoyarte en lo que necesites.';
+        } else if (emojisNeutrales.some(e => textoLimpio.includes(e))) {
+          respuesta = '¿Tienes alguna duda? 🤔 Con gusto te ayudo a resolver cualquier pregunta sobre nuestras casas o el proceso de compra.';
+        } else if (emojisCasa.some(e => textoLimpio.includes(e))) {
+          respuesta = '¡Veo que te interesan las casas! 🏠\n\nTenemos opciones desde $1.5 millones en Zacatecas. ¿Qué tipo de casa buscas? ¿De 2 o 3 recámaras?';
+        } else if (emojisDinero.some(e => textoLimpio.includes(e))) {
+          respuesta = '¡Hablemos de números! 💰\n\nTenemos casas desde $1.5M hasta $5M. Aceptamos INFONAVIT, FOVISSSTE y créditos bancarios.\n\n¿Cuál es tu presupuesto aproximado?';
+        } else {
+          // Emoji no reconocido - respuesta genérica amigable
+          respuesta = `¡Hola! 😊 Soy SARA de Grupo Santa Rita.\n\n¿En qué te puedo ayudar hoy? Tenemos casas increíbles en Zacatecas desde $1.5 millones 🏠`;
+        }
 
-          // Buscar vendedor usando asignación inteligente
-          const { data: todosVendedores } = await supabase.client
-            .from('team_members')
-            .select('*')
-            .eq('active', true);
-
-          const vendedorAsignado = getAvailableVendor(todosVendedores || []);
+        await meta.sendWhatsAppMessage(from, respuesta);
+        return new Response('OK', { status: 200 });
+      }
+      // ═══ FIN MANEJO DE EMOJIS SOLOS ═══
 
-          // Crear lead con datos reales
-          const { data: nuevoLead, error } = await supabase.client
+      // ═══ DETECCIÓN DE LEADS CALIENTES, OBJECIONES Y RESPUESTAS A ENCUESTAS ═══
+      // Detectar señales de compra, objeciones y respuestas NPS ANTES de procesar el mensaje
+      // NOTA: No filtrar por longitud para capturar respuestas NPS cortas como "1", "10"
+      if (text) {
+        try {
+          const cleanPhoneHot = from.replace(/\D/g, '');
+          const { data: leadHot } = await supabase.client
             .from('leads')
-            .insert({
-              name: leadName,
-              phone: leadPhone || null,
-              email: leadEmail || null,
-              source: 'facebook_ads',
-              status: 'new',
-              score: 65, // Score alto porque viene de ads pagados
-              temperature: 'WARM',
-              assigned_to: vendedorAsignado?.id || null,
-              notes: `Lead de Facebook Ads\n${leadNotes}\n---\nLeadgen ID: ${leadgenId}\nForm ID: ${formId}\nPage ID: ${pageId}`
-            })
-            .select()
+            .select('id, name, phone, assigned_to, property_interest, notes, status')
+            .or(`phone.eq.${cleanPhoneHot},phone.like.%${cleanPhoneHot.slice(-10)}`)
             .maybeSingle();
 
-          if (error) {
-            console.error('Error creando lead de Facebook:', error);
-          } else {
-            console.log(`✅ Lead creado: ${nuevoLead.id} - ${leadName}`);
+          if (leadHot) {
+            // PRIMERO: Verificar si hay encuesta pendiente en tabla surveys (enviada desde CRM)
+            const pendingSurvey = await checkPendingSurveyResponse(supabase, meta, cleanPhoneHot, text, leadHot.name);
+            if (pendingSurvey) {
+              console.log(`📋 Respuesta a encuesta CRM procesada para ${leadHot.name} - NO enviar respuesta genérica`);
+              return new Response('OK', { status: 200 });
+            }
 
-            // ═══ ATTRIBUTION TRACKING (auto-wire) ═══
-            try {
-              const attribution = createLeadAttribution(env.SARA_CACHE);
-              await attribution.trackLead(nuevoLead.id, leadPhone || '', {
-                utm_source: 'facebook',
-                utm_medium: 'paid_social',
-                utm_campaign: formId ? `form_${formId}` : undefined,
-                utm_content: pageId ? `page_${pageId}` : undefined,
-              }, leadName);
-              console.log(`📊 Attribution tracked: facebook_ads → ${nuevoLead.id}`);
-            } catch (attrErr) {
-              console.error('⚠️ Attribution tracking error (non-blocking):', attrErr);
+            // SEGUNDO: Procesar respuestas a encuestas de CRONs (NPS, post-entrega, etc.)
+            // Estos pueden ser mensajes cortos como "1", "10", "si", "no"
+            const npsProcessed = leadHot.assigned_to ? await procesarRespuestaNPS(supabase, meta, leadHot, text) : false;
+            if (npsProcessed) {
+              console.log(`📊 Respuesta NPS procesada para ${leadHot.name} - NO enviar respuesta genérica`);
+              return new Response('OK', { status: 200 });
             }
 
-            // Notificar al vendedor asignado
-            if (vendedorAsignado?.phone) {
-              const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
-              await meta.sendWhatsAppMessage(vendedorAsignado.phone,
-                `🎯 *NUEVO LEAD DE FACEBOOK*\n\n` +
-                `👤 *${leadName}*\n` +
-                (leadPhone ? `📱 ${leadPhone}\n` : '') +
-                (leadEmail ? `📧 ${leadEmail}\n` : '') +
-                `\n⏰ ${new Date(createdTime * 1000).toLocaleString('es-MX')}\n\n` +
-                `💡 _Contacta al cliente lo antes posible_`
-              );
+            const entregaProcessed = await procesarRespuestaEntrega(supabase, meta, leadHot, text);
+            if (entregaProcessed) {
+              console.log(`🔑 Respuesta post-entrega procesada para ${leadHot.name} - NO enviar respuesta genérica`);
+              return new Response('OK', { status: 200 });
             }
 
-            // ENVIAR TEMPLATE DE BIENVENIDA AL LEAD (fuera de ventana 24h)
-            if (leadPhone) {
-              const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
-              const primerNombre = leadName.split(' ')[0];
+            const satisfaccionProcessed = await procesarRespuestaSatisfaccionCasa(supabase, meta, leadHot, text);
+            if (satisfaccionProcessed) {
+              console.log(`🏡 Respuesta satisfacción casa procesada para ${leadHot.name} - NO enviar respuesta genérica`);
+              return new Response('OK', { status: 200 });
+            }
 
-              try {
-                // Template: bienvenida_lead_facebook con 1 variable (nombre)
-                const templateComponents = [
-                  {
-                    type: 'body',
-                    parameters: [
-                      { type: 'text', text: primerNombre }
-                    ]
-                  }
-                ];
+            const mantenimientoProcessed = await procesarRespuestaMantenimiento(supabase, meta, leadHot, text);
+            if (mantenimientoProcessed) {
+              console.log(`🔧 Respuesta mantenimiento procesada para ${leadHot.name} - NO enviar respuesta genérica`);
+              return new Response('OK', { status: 200 });
+            }
 
-                await meta.sendTemplate(leadPhone, 'bienvenida_lead_facebook', 'es', templateComponents);
-                console.log(`✅ Template bienvenida enviado a lead de Facebook: ${leadPhone}`);
+            // TERCERO: Capturar feedback post-encuesta (mensaje de seguimiento después de calificar)
+            const feedbackProcessed = await procesarFeedbackEncuesta(supabase, meta, leadHot, text);
+            if (feedbackProcessed) {
+              console.log(`💬 Feedback post-encuesta capturado para ${leadHot.name} - NO enviar respuesta genérica`);
+              return new Response('OK', { status: 200 });
+            }
 
-                // Marcar que se envió template (SARA se activa cuando responda)
-                await supabase.client.from('leads').update({
-                  template_sent: 'bienvenida_lead_facebook',
-                  template_sent_at: new Date().toISOString()
-                }).eq('id', nuevoLead.id);
+            // DESPUÉS: Detectar señales calientes y objeciones (solo para mensajes más largos)
+            if (text.length > 3) {
+              // Detectar señales calientes
+              const señalesCalientes = detectarSeñalesCalientes(text);
+              if (señalesCalientes.length > 0) {
+              console.log(`🔥 Señales calientes detectadas para ${leadHot.name}: ${señalesCalientes.map(s => s.tipo).join(', ')}`);
+              await alertarLeadCaliente(supabase, meta, leadHot, text, señalesCalientes, { openaiApiKey: env.OPENAI_API_KEY });
+            }
 
-              } catch (templateError) {
-                console.error('⚠️ Error enviando template de bienvenida:', templateError);
-                // Si falla el template, al menos el lead ya está creado y el vendedor notificado
-              }
+            // Detectar objeciones
+            const objeciones = detectarObjeciones(text);
+            if (objeciones.length > 0) {
+              console.error(`⚠️ Objeciones detectadas para ${leadHot.name}: ${objeciones.map(o => o.tipo).join(', ')}`);
+              await alertarObjecion(supabase, meta, leadHot, text, objeciones);
+            }
             }
           }
+        } catch (hotErr) {
+          console.error('Error en detección de leads calientes/objeciones:', hotErr);
         }
-
-        return new Response('OK', { status: 200 });
-      } catch (error) {
-        console.error('Facebook Leads Webhook Error:', error);
-        return new Response('OK', { status: 200 });
       }
-    }
-
-
-    // ═══════════════════════════════════════════════════════════════
-    // Webhook Google Calendar - Sincronizar cambios Google → CRM
-    // ═══════════════════════════════════════════════════════════════
-    if (url.pathname === '/webhook/google-calendar' && request.method === 'POST') {
-      try {
-        const channelId = request.headers.get('X-Goog-Channel-ID');
-        const resourceState = request.headers.get('X-Goog-Resource-State');
-        
-        console.log('📅 Google Calendar Webhook:', resourceState, channelId);
-
-        // Solo procesar si hay cambios (no sync inicial)
-        if (resourceState === 'exists' || resourceState === 'update') {
-          console.log('📅 Procesando cambios de Google Calendar...');
-          // TODO Phase 3b: resolve tenant from calendar webhook (e.g. by channel_id or calendar_id)
-          const calendar = new CalendarService(env.GOOGLE_SERVICE_ACCOUNT_EMAIL, env.GOOGLE_PRIVATE_KEY, env.GOOGLE_CALENDAR_ID);
-          const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      // ═══ FIN DETECCIÓN DE LEADS CALIENTES Y OBJECIONES ═══
+
+      // ═══ CAROUSEL QUICK REPLY: Interceptar payloads carousel_ver_* y carousel_cita_* ═══
+      if (buttonPayloadRaw.startsWith('carousel_ver_') || buttonPayloadRaw.startsWith('carousel_cita_')) {
+        const isVerMas = buttonPayloadRaw.startsWith('carousel_ver_');
+        const slug = buttonPayloadRaw.replace(/^carousel_(ver|cita)_/, '');
+        // Reverse slug to development name: monte_verde → Monte Verde
+        const devName = slug.replace(/_/g, ' ').replace(/\b\w/g, (c: string) => c.toUpperCase());
+        console.log(`🎠 Carousel ${isVerMas ? 'VER MÁS' : 'AGENDAR CITA'}: slug="${slug}", desarrollo="${devName}"`);
+
+        if (isVerMas) {
+          // "Ver más" → trigger resource sending (video+GPS+brochure) for that development
+          text = `Quiero ver información de ${devName}`;
+        } else {
+          // "Agendar visita" → trigger appointment flow for that development
+          text = `Quiero agendar una visita a ${devName}`;
+        }
+      }
+      // ═══ FIN CAROUSEL QUICK REPLY ═══
 
-          // Obtener eventos de las últimas 24 horas y próximos 30 días
-          const now = new Date();
-          const yesterday = new Date(now.getTime() - 24 * 60 * 60 * 1000);
-          const nextMonth = new Date(now.getTime() + 30 * 24 * 60 * 60 * 1000);
-          
-          const events = await calendar.getEvents(yesterday.toISOString(), nextMonth.toISOString());
-          const googleEventIds = events.map((e: any) => e.id);
-          console.log(`📅 Eventos en Google Calendar: ${events.length}, IDs: ${googleEventIds.slice(0, 5).join(', ')}...`);
-
-          // 1. DETECTAR EVENTOS ELIMINADOS: Buscar citas que tienen google_event_id pero ya no existen en Google
-          // IMPORTANTE: Solo verificar citas dentro del rango de fechas que consultamos a Google
-          const yesterdayStr = yesterday.toISOString().split('T')[0];
-          const nextMonthStr = nextMonth.toISOString().split('T')[0];
-
-          // ✅ FIX 14-ENE-2026: También detectar citas completadas que fueron borradas del calendario
-          // ✅ FIX 15-ENE-2026: Incluir canceladas para poder verificar si Sara ya canceló
-          const { data: citasConGoogle } = await supabase.client
-            .from('appointments')
-            .select('*')
-            .not('google_event_vendedor_id', 'is', null)
-            .in('status', ['scheduled', 'completed', 'cancelled']) // Incluir canceladas para verificar
-            .gte('scheduled_date', yesterdayStr)  // Solo citas desde ayer
-            .lte('scheduled_date', nextMonthStr); // Hasta próximo mes
-          
-          console.log(`📅 Citas con google_event_vendedor_id en BD: ${citasConGoogle?.length || 0}`);
-          if (citasConGoogle && citasConGoogle.length > 0) {
-            console.log(`📅 IDs de eventos en citas: ${citasConGoogle.map(c => c.google_event_vendedor_id?.substring(0,15)).join(', ')}`);
-          }
+      // ═══ SLOT SCHEDULING REPLY: Handle slot_* list replies ═══
+      if (buttonPayloadRaw.startsWith('slot_')) {
+        try {
+          const { SlotSchedulingService } = await import('./services/slotSchedulingService');
+          const slotService = new SlotSchedulingService();
+          const slotParsed = slotService.parseSlotId(buttonPayloadRaw);
 
-          if (citasConGoogle) {
-            for (const cita of citasConGoogle) {
-              if (cita.google_event_vendedor_id && !googleEventIds.includes(cita.google_event_vendedor_id)) {
-                // El evento fue eliminado de Google Calendar
+          if (slotParsed) {
+            // Look up the lead
+            const { data: slotLead } = await supabase.client
+              .from('leads')
+              .select('id, name, phone, status, assigned_to, property_interest, notes')
+              .eq('phone', from)
+              .single();
+
+            if (slotLead) {
+              const { AppointmentSchedulingService } = await import('./services/appointmentSchedulingService');
+              const { CalendarService: CalSvc } = await import('./services/calendar');
+              const slotCalendar = new CalSvc(
+                tenant.config.googleServiceAccountEmail || env.GOOGLE_SERVICE_ACCOUNT_EMAIL,
+                tenant.config.googlePrivateKey || env.GOOGLE_PRIVATE_KEY,
+                tenant.config.googleCalendarId || env.GOOGLE_CALENDAR_ID
+              );
+              const appointmentService = new AppointmentSchedulingService(supabase, slotCalendar);
+
+              // Get team members for vendedor assignment
+              const slotTeamMembers = await getEntityCache(supabase, env.SARA_CACHE).getTeamMembers().catch(() => [] as any[]);
+
+              const vendedorSlot = slotTeamMembers?.find((t: any) => t.id === slotLead.assigned_to) ||
+                               slotTeamMembers?.find((t: any) => t.role === 'vendedor' && t.active);
+
+              const desarrollo = slotLead.property_interest || 'Por definir';
+
+              // Parse slot time: "10:00" → hora=10, ampm=am; "14:00" → hora=2, ampm=pm
+              const slotHourNum = parseInt(slotParsed.time.split(':')[0]);
+              const slotAmpm = slotHourNum >= 12 ? 'pm' : 'am';
+              const slotHour12 = slotHourNum > 12 ? slotHourNum - 12 : (slotHourNum === 0 ? 12 : slotHourNum);
+              const slotMinutes = slotParsed.time.split(':')[1] || '00';
+
+              const citaResult = await appointmentService.agendarCitaConSeleccion(
+                slotLead,
+                slotParsed.date,  // ISO date string
+                String(slotHour12),
+                slotAmpm,
+                vendedorSlot || { id: '', name: 'Sin asignar', role: 'vendedor' },
+                slotMinutes,
+                desarrollo
+              );
 
-                // ═══ FIX: Ignorar citas ya procesadas por Sara ═══
-                if (cita.status === 'rescheduled') {
-                  console.log(`📅 Evento eliminado pero cita ya reagendada, ignorando: ${cita.id}`);
-                  continue;
-                }
-                if (cita.status === 'cancelled') {
-                  console.log(`📅 Evento eliminado pero cita ya cancelada por Sara, ignorando: ${cita.id}`);
-                  continue;
-                }
+              if (citaResult.success) {
+                await meta.sendWhatsAppMessage(from,
+                  `✅ *¡Cita agendada!*\n\n` +
+                  `📅 ${citaResult.fecha}\n` +
+                  `🕐 ${citaResult.hora}\n` +
+                  `🏠 ${desarrollo}\n\n` +
+                  `Te esperamos. Si necesitas cambiar algo, escribe *reagendar* o *cancelar cita*.`
+                );
+              } else {
+                await meta.sendWhatsAppMessage(from,
+                  citaResult.error || '⚠️ No pude agendar la cita. ¿Podrías darme la fecha y hora que prefieres?'
+                );
+              }
 
-                // Solo actualizar BD - NO enviar notificaciones (Sara se encarga de eso)
-                const eraCompletada = cita.status === 'completed';
-                console.log(`📅 Evento eliminado de Google, actualizando BD: ${cita.id} (era: ${cita.status})`);
+              // Clear pending_slot_selection
+              const slotNotes = typeof slotLead.notes === 'object' ? slotLead.notes : {};
+              delete slotNotes.pending_slot_selection;
+              await supabase.client.from('leads').update({ notes: slotNotes }).eq('id', slotLead.id);
 
-                await supabase.client
-                  .from('appointments')
-                  .update({
-                    status: 'cancelled',
-                    cancelled_by: eraCompletada ? 'Google Calendar (eliminado post-visita)' : 'Google Calendar (eliminado)',
-                  })
-                  .eq('id', cita.id);
-
-                console.log(`📅 Cita ${cita.id} marcada como cancelada (sin notificaciones - Sara se encarga)`);
-              }
+              return new Response('OK', { status: 200 });
             }
           }
-          
-          // 2. PROCESAR CAMBIOS EN EVENTOS EXISTENTES
-          for (const event of events) {
-            // Buscar cita en DB por google_event_id
-            const { data: appointment } = await supabase.client
-              .from('appointments')
-              .select('*')
-              .eq('google_event_vendedor_id', event.id)
-              .maybeSingle();
-            
-            if (appointment) {
-              // Verificar si el evento fue cancelado (marcado como cancelled en Google)
-              if (event.status === 'cancelled') {
-                // Solo procesar si no estaba ya cancelado
-                if (appointment.status !== 'cancelled') {
-                  await supabase.client
-                    .from('appointments')
-                    .update({ 
-                      status: 'cancelled', 
-                      cancelled_by: 'Google Calendar',
-                    })
-                    .eq('id', appointment.id);
-                  console.log('📅 Cita cancelada desde Google:', appointment.id);
-                  
-                  // Notificar al LEAD por WhatsApp
-                  if (appointment.lead_phone) {
-                    try {
-                      const fechaStr = new Date(appointment.scheduled_date + 'T12:00:00').toLocaleDateString('es-MX', { weekday: 'long', day: 'numeric', month: 'long' });
-                      const msgLead = `❌ *CITA CANCELADA*\n\nHola ${appointment.lead_name?.split(' ')[0] || ''} 👋\n\nTu cita del ${fechaStr} a las ${(appointment.scheduled_time || '').substring(0,5)} ha sido cancelada.\n\nSi deseas reagendar, contáctanos. ¡Estamos para servirte! 🏠`;
-                      const phoneLead = appointment.lead_phone.replace(/[^0-9]/g, '');
-                      await meta.sendWhatsAppMessage(phoneLead, msgLead);
-                      console.log('📤 Notificación cancelación (Google→WhatsApp) a lead:', appointment.lead_name);
-                    } catch (e) {
-                      console.error('⚠️ Error notificando lead:', e);
-                    }
+        } catch (slotErr) {
+          console.error('Error processing slot selection:', slotErr);
+          // Fall through to normal message handling
+        }
+      }
+      // ═══ FIN SLOT SCHEDULING REPLY ═══
+
+      // ═══ RECURSO QUICK REPLY: Handle recurso_gps_*, recurso_brochure_*, recurso_video_*, recurso_3d_* ═══
+      if (buttonPayloadRaw.startsWith('recurso_')) {
+        const recursoMatch = buttonPayloadRaw.match(/^recurso_(gps|brochure|video|3d)_(.+)$/);
+        if (recursoMatch) {
+          const recursoType = recursoMatch[1]; // gps, brochure, video, 3d
+          const slug = recursoMatch[2]; // monte_verde, andes, etc.
+          const devName = slug.replace(/_/g, ' ').replace(/\b\w/g, (c: string) => c.toUpperCase());
+          console.log(`🖼️ Recurso button tap: tipo="${recursoType}", slug="${slug}", desarrollo="${devName}"`);
+
+          try {
+            // Look up property in DB by development name
+            const slugNorm = slug.replace(/_/g, ' ');
+            const { data: recursoProps } = await supabase.client
+              .from('properties')
+              .select('development, name, gps_link, youtube_link, matterport_link, brochure_urls')
+              .ilike('development', `%${slugNorm}%`)
+              .limit(5);
+            const propMatch = (recursoProps || [])[0];
+
+            if (propMatch) {
+              let recursoEnviado = false;
+              if (recursoType === 'gps' && propMatch.gps_link) {
+                await meta.sendCTAButton(from,
+                  `📍 Ubicación de *${devName}*`,
+                  'Abrir en Maps 📍',
+                  propMatch.gps_link
+                );
+                recursoEnviado = true;
+                console.log(`✅ GPS CTA enviado para ${devName}`);
+              } else if (recursoType === 'brochure') {
+                const brochureUrl = Array.isArray(propMatch.brochure_urls)
+                  ? propMatch.brochure_urls[0]
+                  : (typeof propMatch.brochure_urls === 'string' ? propMatch.brochure_urls : null);
+                if (brochureUrl) {
+                  if (brochureUrl.includes('.html') || brochureUrl.includes('pages.dev')) {
+                    await meta.sendCTAButton(from,
+                      `📋 Brochure de *${devName}*`,
+                      'Ver brochure 📋',
+                      brochureUrl
+                    );
+                  } else {
+                    // PDF brochure → send as document
+                    const filename = `Brochure_${devName.replace(/\s+/g, '_')}.pdf`;
+                    await meta.sendWhatsAppDocument(from, brochureUrl, filename, `📋 Brochure ${devName}`);
                   }
+                  recursoEnviado = true;
+                  console.log(`✅ Brochure enviado para ${devName}`);
+                } else {
+                  // Fallback brochure URL
+                  const fallbackUrl = `https://sara-backend.edson-633.workers.dev/brochure/${slug.replace(/_/g, '-').replace(/\.html$/, '')}`;
+                  await meta.sendCTAButton(from,
+                    `📋 Brochure de *${devName}*`,
+                    'Ver brochure 📋',
+                    fallbackUrl
+                  );
+                  recursoEnviado = true;
+                  console.log(`✅ Brochure fallback enviado para ${devName}`);
                 }
+              } else if (recursoType === 'video' && propMatch.youtube_link) {
+                await meta.sendCTAButton(from,
+                  `🎬 Video de *${devName}*`,
+                  'Ver video 🎬',
+                  propMatch.youtube_link
+                );
+                recursoEnviado = true;
+                console.log(`✅ Video CTA enviado para ${devName}`);
+              } else if (recursoType === '3d' && propMatch.matterport_link) {
+                await meta.sendCTAButton(from,
+                  `🏠 Recorrido 3D de *${devName}*`,
+                  'Ver recorrido 🏠',
+                  propMatch.matterport_link
+                );
+                recursoEnviado = true;
+                console.log(`✅ Matterport CTA enviado para ${devName}`);
               } else {
-                // Actualizar fecha/hora si cambió
-                const dateTimeStr = event.start?.dateTime || event.start?.date || '';
-                const newDate = dateTimeStr.substring(0, 10);
-                const newTime = dateTimeStr.substring(11, 16);
-                
-                if (newDate && newTime && (appointment.scheduled_date !== newDate || (appointment.scheduled_time || '').substring(0,5) !== newTime)) {
-                  const oldDate = appointment.scheduled_date;
-                  const oldTime = (appointment.scheduled_time || '').substring(0,5);
-
-                  // ═══ VERIFICAR SI SARA YA REAGENDÓ (evitar duplicados) ═══
-                  // Verificar si las notas indican que Sara ya reagendó a esta fecha/hora
-                  const notes = appointment.notes || '';
-                  if (notes.includes('Reagendada') && notes.includes('→')) {
-                    // Formato: "Reagendada de 2026-01-16 10:00 → 2026-01-16 11:15"
-                    const partes = notes.split('→');
-                    if (partes.length >= 2) {
-                      const destino = partes[1].trim(); // "2026-01-16 11:15"
-                      if (destino.includes(newDate) && destino.includes(newTime)) {
-                        console.log('📅 Webhook Calendar: Ignorando - Sara ya reagendó a', destino);
-                        continue; // Saltar notificaciones, Sara ya las envió
-                      }
-                    }
-                  }
+                // Resource not available for this development
+                await meta.sendWhatsAppMessage(from,
+                  `Lo siento, ese recurso no está disponible para *${devName}*. ¿Te puedo ayudar con algo más?`);
+                console.log(`⚠️ Recurso "${recursoType}" no disponible para ${devName}`);
+              }
 
-                  // Solo actualizar BD - NO enviar notificaciones (Sara ya las envía)
-                  await supabase.client
-                    .from('appointments')
-                    .update({
-                      scheduled_date: newDate,
-                      scheduled_time: newTime,
-                      property_name: event.location || appointment.property_name,
-                    })
-                    .eq('id', appointment.id);
-                  console.log('📅 Cita sincronizada desde Google Calendar:', appointment.id, newDate, newTime);
-                  console.log('📅 (Sin notificaciones - Sara ya las envió)');
-                }
+              // Follow-up de venta después de enviar recurso
+              if (recursoEnviado) {
+                await new Promise(r => setTimeout(r, 1000));
+                const followUps: Record<string, string> = {
+                  'gps': `¿Te gustaría visitar *${devName}*? Puedo agendarte una visita este fin de semana 🏡`,
+                  'video': `¿Qué te pareció? Si quieres conocerlo en persona, te agendo una visita. ¿Sábado o domingo? 📅`,
+                  '3d': `¿Te gustó el recorrido? Nada como verlo en persona. ¿Qué día te funciona para visitarlo? 🏠`,
+                  'brochure': `Ahí tienes todos los detalles. ¿Te gustaría agendar una visita para conocer *${devName}*? 📅`,
+                };
+                await meta.sendWhatsAppMessage(from, followUps[recursoType] || `¿Te gustaría visitar *${devName}*? 🏡`);
+                console.log(`✅ Follow-up de venta enviado después de recurso ${recursoType}`);
               }
+            } else {
+              console.error(`⚠️ No se encontró propiedad para slug: ${slug}`);
+              await meta.sendWhatsAppMessage(from,
+                `No encontré información de ese desarrollo. ¿Cuál te interesa conocer?`);
             }
+          } catch (recursoErr) {
+            console.error('❌ Error procesando recurso button:', recursoErr);
+            // Fall through to normal AI processing
           }
+          return new Response('OK', { status: 200 });
         }
-        
-        return new Response('OK', { status: 200 });
-      } catch (error) {
-        console.error('Google Calendar Webhook Error:', error);
-        return new Response('OK', { status: 200 });
       }
-    }
+      // ═══ FIN RECURSO QUICK REPLY ═══
+
+      // ═══ LIST MENU QUICK REPLY: Rewrite cmd_* payloads to recognizable commands ═══
+      if (buttonPayloadRaw.startsWith('cmd_')) {
+        const cmdMap: Record<string, string> = {
+          'cmd_mis_leads': 'mis leads',
+          'cmd_citas': 'citas',
+          'cmd_hot': 'hot',
+          'cmd_pendientes': 'pendientes'
+        };
+
+        if (cmdMap[buttonPayloadRaw]) {
+          text = cmdMap[buttonPayloadRaw];
+          console.log(`📱 List menu cmd rewrite: "${buttonPayloadRaw}" → "${text}"`);
+        } else if (buttonPayloadRaw.startsWith('cmd_oferta_')) {
+          const leadSlug = buttonPayloadRaw.replace('cmd_oferta_', '').replace(/_/g, ' ');
+          text = `oferta ${leadSlug}`;
+          console.log(`📱 List menu oferta rewrite: "${buttonPayloadRaw}" → "${text}"`);
+        } else if (buttonPayloadRaw.startsWith('cmd_quien_es_')) {
+          const nameSlug = buttonPayloadRaw.replace('cmd_quien_es_', '').replace(/_/g, ' ');
+          text = `quien es ${nameSlug}`;
+          console.log(`📱 List menu quien_es rewrite: "${buttonPayloadRaw}" → "${text}"`);
+        } else if (buttonPayloadRaw.startsWith('btn_credito_')) {
+          const tipoCredito = buttonPayloadRaw.replace('btn_credito_', '');
+          const creditoMap: Record<string, string> = {
+            'infonavit': 'Quiero información sobre crédito INFONAVIT',
+            'bancario': 'Quiero información sobre crédito bancario',
+            'cofinavit': 'Quiero información sobre crédito Cofinavit',
+            'fovissste': 'Quiero información sobre crédito FOVISSSTE'
+          };
+          text = creditoMap[tipoCredito] || `Quiero crédito ${tipoCredito}`;
+          console.log(`📱 List menu crédito rewrite: "${buttonPayloadRaw}" → "${text}"`);
+        }
+      }
+      // ═══ FIN LIST MENU QUICK REPLY ═══
 
+      await handler.handleIncomingMessage(`whatsapp:+${from}`, text, env);
 
+      console.log('✅ Mensaje procesado correctamente');
 
+      // Cancelar follow-ups cuando el lead responde
+      const followupService = new FollowupService(supabase);
+      await followupService.cancelarPorRespuesta('', from);
+    } else {
+      console.error('⚠️ No hay mensajes en el webhook (puede ser status update)');
+    }
 
+    return new Response('OK', { status: 200 });
+  } catch (error) {
+    console.error('❌ Meta Webhook Error:', error);
 
+    // RECOVERY: Si el procesamiento falló, eliminar la marca KV para que
+    // el retry de Meta NO sea rechazado como duplicado (Lead Fantasma fix)
+    if (kvDedupKey) {
+      try {
+        await env.SARA_CACHE.delete(kvDedupKey);
+        console.log(`🔄 KV dedup cleared for retry: ${kvDedupKey}`);
+      } catch (kvCleanErr) {
+        console.warn('KV cleanup failed (non-critical):', kvCleanErr);
+      }
+    }
 
+    // Persist to error_logs + real-time alerting
+    ctx.waitUntil(logErrorToDB(supabase, 'webhook_error', error instanceof Error ? error.message : String(error), {
+      severity: 'critical',
+      source: 'webhook:meta',
+      stack: error instanceof Error ? error.stack : undefined,
+      context: { from: from || 'unknown', messageId: messageId || 'unknown' }
+    }));
+    ctx.waitUntil(alertOnCriticalError(supabase, meta, env, 'webhook_error', error instanceof Error ? error.message : String(error), 'webhook:meta'));
+
+    if (opts.rethrow) throw error;
+    return new Response('OK', { status: 200 });
+  }
+}
+
+// ═══════════════════════════════════════════════════════════════
+// Webhook Facebook Lead Ads - verificación GET
+// ═══════════════════════════════════════════════════════════════
+async function handleFacebookLeadsVerify({ url }: RouteContext): Promise<Response | null> {
+  const mode = url.searchParams.get('hub.mode');
+  const token = url.searchParams.get('hub.verify_token');
+  const challenge = url.searchParams.get('hub.challenge');
+
+  if (mode === 'subscribe' && token === 'sara_fb_leads_token') {
+    console.log('✅ Facebook Leads webhook verified');
+    return new Response(challenge, { status: 200 });
+  }
+  return new Response('Forbidden', { status: 403 });
+}
+
+// ═══════════════════════════════════════════════════════════════
+// Webhook Facebook Lead Ads - Recibir leads de Meta Ads
+// ═══════════════════════════════════════════════════════════════
+async function handleFacebookLeadsWebhook({ url, request, env, supabase }: RouteContext): Promise<Response | null> {
+  try {
+    // Leer body como texto para verificar firma
+    const bodyText = await request.text();
+
+    // Verificar firma si META_WEBHOOK_SECRET está configurado
+    if (env.META_WEBHOOK_SECRET) {
+      const isValid = await verifyMetaSignature(request, bodyText, env.META_WEBHOOK_SECRET);
+      if (!isValid) {
+        console.error('🚫 FACEBOOK LEADS: Firma inválida - posible spoofing');
+        return new Response('Invalid signature', { status: 401 });
+      }
+      console.log('✅ FACEBOOK LEADS: Firma verificada');
+    } else {
+      console.warn('⚠️ META_WEBHOOK_SECRET no configurado - webhooks sin verificar');
+    }
 
-    // ═══════════════════════════════════════════════════════════════
-    // A/B TEST RESULTS - Ver resultados
-    // ═══════════════════════════════════════════════════════════════
-    if (url.pathname === '/ab-results') {
-      const testName = url.searchParams.get('test') || 'welcome_message';
-      const results = await getABTestResults(supabase, testName);
-      return corsResponse(JSON.stringify(results || { error: 'No results found' }));
+    const body = safeJsonParse(bodyText, null);
+    if (!body) {
+      console.error('❌ FACEBOOK LEADS: JSON inválido, bodyText:', bodyText?.substring(0, 200));
+      return new Response('OK', { status: 200 });
     }
+    console.log('🔥 Facebook Lead recibido:', JSON.stringify(body));
 
-    // ═══ E2E TEST: Resilience Features ═══
-    if (url.pathname === '/test-resilience-e2e') {
-      const tests: Array<{ name: string; pass: boolean; detail: string }> = [];
+    const entry = body?.entry?.[0];
+    const changes = entry?.changes?.[0];
 
-      // ── TEST 1: retry_queue table exists ──
-      try {
-        const { data: rqData, error: rqErr } = await supabase.client.from('retry_queue').select('id', { count: 'exact', head: true });
-        tests.push({ name: 'retry_queue table exists', pass: !rqErr, detail: rqErr ? rqErr.message : 'OK' });
-      } catch (e: any) { tests.push({ name: 'retry_queue table exists', pass: false, detail: e.message }); }
+    // Facebook Lead Ads envía el campo "leadgen_id"
+    if (changes?.field === 'leadgen' && changes?.value?.leadgen_id) {
+      const leadgenId = changes.value.leadgen_id;
+      const formId = changes.value.form_id;
+      const pageId = changes.value.page_id;
+      const createdTime = changes.value.created_time;
 
-      // ── TEST 2: enqueueFailedMessage inserts retryable error ──
+      // KV dedup — prevent duplicate processing of same Facebook lead
       try {
-        await enqueueFailedMessage(supabase, '5210000099999', 'text', { body: 'E2E test message' }, 'e2e-test', 'Meta API error 500: Internal Server Error');
-        const { data: inserted } = await supabase.client.from('retry_queue').select('*').eq('recipient_phone', '5210000099999').eq('context', 'e2e-test').order('created_at', { ascending: false }).limit(1);
-        const ok = inserted && inserted.length > 0 && inserted[0].status === 'pending';
-        tests.push({ name: 'enqueueFailedMessage inserts pending entry', pass: !!ok, detail: ok ? `id=${inserted![0].id}` : 'No row found' });
-      } catch (e: any) { tests.push({ name: 'enqueueFailedMessage inserts pending entry', pass: false, detail: e.message }); }
+        const fbDedupKey = `fblead:${leadgenId}`;
+        if (await env.SARA_CACHE.get(fbDedupKey)) {
+          console.log(`⏭️ Facebook lead ya procesado: ${leadgenId}`);
+          return new Response('OK', { status: 200 });
+        }
+        await env.SARA_CACHE.put(fbDedupKey, '1', { expirationTtl: 86400 });
+      } catch (_kvErr) { /* fallback: DB phone dedup below */ }
 
-      // ── TEST 3: enqueueFailedMessage skips non-retryable (400) ──
-      try {
-        const { count: before } = await supabase.client.from('retry_queue').select('id', { count: 'exact', head: true }).eq('recipient_phone', '5210000088888');
-        await enqueueFailedMessage(supabase, '5210000088888', 'text', { body: 'skip' }, 'e2e-skip', 'Meta API error 400: Bad Request');
-        const { count: after } = await supabase.client.from('retry_queue').select('id', { count: 'exact', head: true }).eq('recipient_phone', '5210000088888');
-        const ok = (after || 0) === (before || 0);
-        tests.push({ name: 'enqueueFailedMessage skips 400 error', pass: ok, detail: ok ? 'Correctly skipped' : `before=${before} after=${after}` });
-      } catch (e: any) { tests.push({ name: 'enqueueFailedMessage skips 400 error', pass: false, detail: e.message }); }
+      console.log(`🎯 Nuevo lead de Facebook: ${leadgenId}`);
 
-      // Create meta instance for tests that need it
-      const testMeta = await createMetaWithTracking(env, supabase);
+      // Obtener datos reales del lead desde Graph API
+      let leadName = `Facebook Lead ${leadgenId.slice(-6)}`;
+      let leadPhone = '';
+      let leadEmail = '';
+      let leadNotes = '';
 
-      // ── TEST 4: processRetryQueue processes & delivers test entry ──
       try {
-        const rqResult = await processRetryQueue(supabase, testMeta, env.DEV_PHONE || '5610016226');
-        tests.push({ name: 'processRetryQueue runs without error', pass: true, detail: `processed=${rqResult.processed} delivered=${rqResult.delivered} failed=${rqResult.failedPermanent}` });
-      } catch (e: any) { tests.push({ name: 'processRetryQueue runs without error', pass: false, detail: e.message }); }
+        const fbCtrl = new AbortController();
+        const fbTimer = setTimeout(() => fbCtrl.abort(), 10_000);
+        const graphResponse = await fetch(
+          `https://graph.facebook.com/v18.0/${leadgenId}?access_token=${env.META_ACCESS_TOKEN}`,
+          { signal: fbCtrl.signal }
+        );
+        clearTimeout(fbTimer);
+
+        if (graphResponse.ok) {
+          const leadData = await graphResponse.json() as any;
+          console.log('📋 Datos del lead:', JSON.stringify(leadData));
+
+          // Parsear field_data del formulario
+          if (leadData.field_data) {
+            for (const field of leadData.field_data) {
+              const fieldName = field.name?.toLowerCase() || '';
+              const fieldValue = field.values?.[0] || '';
+
+              if (fieldName.includes('name') || fieldName.includes('nombre')) {
+                leadName = fieldValue || leadName;
+              } else if (fieldName.includes('phone') || fieldName.includes('tel') || fieldName.includes('whatsapp') || fieldName.includes('celular')) {
+                leadPhone = fieldValue.replace(/\D/g, ''); // Solo números
+                // Agregar 521 si es número mexicano de 10 dígitos
+                if (leadPhone.length === 10) {
+                  leadPhone = '521' + leadPhone;
+                }
+              } else if (fieldName.includes('email') || fieldName.includes('correo')) {
+                leadEmail = fieldValue;
+              } else {
+                // Otros campos van a notas
+                leadNotes += `${field.name}: ${fieldValue}\n`;
+              }
+            }
+          }
+        } else {
+          console.error('❌ Error obteniendo datos de Graph API:', await graphResponse.text());
+        }
+      } catch (graphError) {
+        console.error('❌ Error llamando Graph API:', graphError);
+      }
 
-      // ── TEST 5: processRetryQueue increments attempts on failure ──
-      try {
-        const { data: updated } = await supabase.client.from('retry_queue').select('*').eq('recipient_phone', '5210000099999').eq('context', 'e2e-test').order('created_at', { ascending: false }).limit(1);
-        const entry = updated?.[0];
-        const ok = entry && entry.attempts >= 1;
-        tests.push({ name: 'retry entry attempts incremented after processing', pass: !!ok, detail: entry ? `attempts=${entry.attempts} status=${entry.status}` : 'No entry found' });
-      } catch (e: any) { tests.push({ name: 'retry entry attempts incremented after processing', pass: false, detail: e.message }); }
+      // Verificar si el lead ya existe (por teléfono o leadgen_id)
+      let existingLead = null;
+      if (leadPhone) {
+        const { data: byPhone } = await supabase.client
+          .from('leads')
+          .select('*')
+          .eq('phone', leadPhone)
+          .maybeSingle();
+        existingLead = byPhone;
+      }
 
-      // ── TEST 6: KV dedup write ──
-      try {
-        const testKey = 'wamsg:e2e_test_msg_' + Date.now();
-        await env.SARA_CACHE.put(testKey, '1', { expirationTtl: 60 });
-        const val = await env.SARA_CACHE.get(testKey);
-        tests.push({ name: 'KV dedup write + read works', pass: val === '1', detail: val === '1' ? 'OK' : `got: ${val}` });
-      } catch (e: any) { tests.push({ name: 'KV dedup write + read works', pass: false, detail: e.message }); }
+      if (existingLead) {
+        console.error(`⚠️ Lead ya existe: ${existingLead.id}`);
+        // Actualizar con datos de Facebook si es más reciente
+        const { error: fbUpdateErr } = await supabase.client.from('leads').update({
+          source: 'facebook_ads',
+          notes: `${existingLead.notes || ''}\n---\nActualizado desde Facebook Lead ${leadgenId} el ${new Date().toLocaleString('es-MX')}`
+        }).eq('id', existingLead.id);
+        if (fbUpdateErr) console.error('⚠️ Error actualizando lead de Facebook:', fbUpdateErr.message);
 
-      // ── TEST 7: KV dedup blocks duplicate messageId ──
-      try {
-        const dupKey = 'wamsg:e2e_dup_test_' + Date.now();
-        await env.SARA_CACHE.put(dupKey, '1', { expirationTtl: 60 });
-        const hit = await env.SARA_CACHE.get(dupKey);
-        tests.push({ name: 'KV dedup detects duplicate messageId', pass: hit === '1', detail: hit === '1' ? 'Duplicate correctly detected' : `got: ${hit}` });
-      } catch (e: any) { tests.push({ name: 'KV dedup detects duplicate messageId', pass: false, detail: e.message }); }
+        return new Response('OK', { status: 200 });
+      }
 
-      // ── TEST 8: KV dedup returns null for new messageId ──
-      try {
-        const newKey = 'wamsg:e2e_new_test_' + Date.now() + '_unique';
-        const miss = await env.SARA_CACHE.get(newKey);
-        tests.push({ name: 'KV dedup returns null for new messageId', pass: miss === null, detail: miss === null ? 'Correctly null' : `got: ${miss}` });
-      } catch (e: any) { tests.push({ name: 'KV dedup returns null for new messageId', pass: false, detail: e.message }); }
+      // Buscar vendedor usando asignación inteligente
+      const todosVendedores = await getEntityCache(supabase, env.SARA_CACHE).getTeamMembers().catch(() => [] as any[]);
+
+      const vendedorAsignado = getAvailableVendor(todosVendedores || []);
+
+      // Crear lead con datos reales
+      const { data: nuevoLead, error } = await supabase.client
+        .from('leads')
+        .insert({
+          name: leadName,
+          phone: leadPhone || null,
+          email: leadEmail || null,
+          source: 'facebook_ads',
+          status: 'new',
+          score: 65, // Score alto porque viene de ads pagados
+          temperature: 'WARM',
+          assigned_to: vendedorAsignado?.id || null,
+          notes: `Lead de Facebook Ads\n${leadNotes}\n---\nLeadgen ID: ${leadgenId}\nForm ID: ${formId}\nPage ID: ${pageId}`
+        })
+        .select()
+        .maybeSingle();
+
+      if (error) {
+        console.error('Error creando lead de Facebook:', error);
+      } else {
+        console.log(`✅ Lead creado: ${nuevoLead.id} - ${leadName}`);
 
-      // ── TEST 9: AI fallback code path exists (import check) ──
-      try {
-        const hasLogErrorToDB = typeof logErrorToDB === 'function';
-        const hasEnviarMensaje = typeof enviarMensajeTeamMember === 'function';
-        tests.push({ name: 'AI fallback dependencies available (logErrorToDB + enviarMensajeTeamMember)', pass: hasLogErrorToDB && hasEnviarMensaje, detail: `logErrorToDB=${hasLogErrorToDB} enviarMensajeTeamMember=${hasEnviarMensaje}` });
-      } catch (e: any) { tests.push({ name: 'AI fallback dependencies available', pass: false, detail: e.message }); }
+        // ═══ ATTRIBUTION TRACKING (auto-wire) ═══
+        try {
+          const attribution = createLeadAttribution(env.SARA_CACHE);
+          await attribution.trackLead(nuevoLead.id, leadPhone || '', {
+            utm_source: 'facebook',
+            utm_medium: 'paid_social',
+            utm_campaign: formId ? `form_${formId}` : undefined,
+            utm_content: pageId ? `page_${pageId}` : undefined,
+          }, leadName);
+          console.log(`📊 Attribution tracked: facebook_ads → ${nuevoLead.id}`);
+        } catch (attrErr) {
+          console.error('⚠️ Attribution tracking error (non-blocking):', attrErr);
+        }
 
-      // ── TEST 10: AI fallback - logErrorToDB writes to error_logs ──
-      try {
-        await logErrorToDB(supabase, 'e2e_test_error', 'Resilience E2E test - safe to ignore', { severity: 'warning' as any, source: 'e2e-test-resilience', context: { test: true } });
-        const { data: errLog } = await supabase.client.from('error_logs').select('id').eq('error_type', 'e2e_test_error').eq('source', 'e2e-test-resilience').order('created_at', { ascending: false }).limit(1);
-        const ok = errLog && errLog.length > 0;
-        tests.push({ name: 'logErrorToDB writes to error_logs table', pass: !!ok, detail: ok ? `id=${errLog![0].id}` : 'No row found' });
-        // Cleanup
-        if (ok) await supabase.client.from('error_logs').delete().eq('id', errLog![0].id);
-      } catch (e: any) { tests.push({ name: 'logErrorToDB writes to error_logs table', pass: false, detail: e.message }); }
-
-      // ── TEST 11: failedMessageCallback is wired in MetaWhatsAppService ──
-      try {
-        const hasCallback = typeof (testMeta as any).failedMessageCallback === 'function';
-        tests.push({ name: 'MetaWhatsAppService has failedMessageCallback wired', pass: hasCallback, detail: hasCallback ? 'Callback is set' : 'Callback is null/undefined' });
-      } catch (e: any) { tests.push({ name: 'MetaWhatsAppService has failedMessageCallback wired', pass: false, detail: e.message }); }
+        // Notificar al vendedor asignado
+        if (vendedorAsignado?.phone) {
+          const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+          await meta.sendWhatsAppMessage(vendedorAsignado.phone,
+            `🎯 *NUEVO LEAD DE FACEBOOK*\n\n` +
+            `👤 *${leadName}*\n` +
+            (leadPhone ? `📱 ${leadPhone}\n` : '') +
+            (leadEmail ? `📧 ${leadEmail}\n` : '') +
+            `\n⏰ ${new Date(createdTime * 1000).toLocaleString('es-MX')}\n\n` +
+            `💡 _Contacta al cliente lo antes posible_`
+          );
+        }
 
-      // ── TEST 12: trackingCallback is also wired (sanity) ──
-      try {
-        const hasTracking = typeof (testMeta as any).trackingCallback === 'function';
-        tests.push({ name: 'MetaWhatsAppService has trackingCallback wired (sanity)', pass: hasTracking, detail: hasTracking ? 'OK' : 'Missing' });
-      } catch (e: any) { tests.push({ name: 'MetaWhatsAppService has trackingCallback wired', pass: false, detail: e.message }); }
+        // ENVIAR TEMPLATE DE BIENVENIDA AL LEAD (fuera de ventana 24h)
+        if (leadPhone) {
+          const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+          const primerNombre = leadName.split(' ')[0];
 
-      // ── CLEANUP: Remove test entries from retry_queue ──
-      try {
-        await supabase.client.from('retry_queue').delete().eq('recipient_phone', '5210000099999');
-        await supabase.client.from('retry_queue').delete().eq('recipient_phone', '5210000088888');
-      } catch (_) {}
+          try {
+            // Template: bienvenida_lead_facebook con 1 variable (nombre)
+            const templateComponents = [
+              {
+                type: 'body',
+                parameters: [
+                  { type: 'text', text: primerNombre }
+                ]
+              }
+            ];
 
-      const passed = tests.filter(t => t.pass).length;
-      const failed = tests.filter(t => !t.pass).length;
+            await meta.sendTemplate(leadPhone, 'bienvenida_lead_facebook', 'es', templateComponents);
+            console.log(`✅ Template bienvenida enviado a lead de Facebook: ${leadPhone}`);
 
-      return corsResponse(JSON.stringify({
-        summary: `${passed}/${tests.length} passed, ${failed} failed`,
-        timestamp: new Date().toISOString(),
-        tests
-      }, null, 2));
+            // Marcar que se envió template (SARA se activa cuando responda)
+            await supabase.client.from('leads').update({
+              template_sent: 'bienvenida_lead_facebook',
+              template_sent_at: new Date().toISOString()
+            }).eq('id', nuevoLead.id);
+
+          } catch (templateError) {
+            console.error('⚠️ Error enviando template de bienvenida:', templateError);
+            // Si falla el template, al menos el lead ya está creado y el vendedor notificado
+          }
+        }
+      }
     }
 
+    return new Response('OK', { status: 200 });
+  } catch (error) {
+    console.error('Facebook Leads Webhook Error:', error);
+    return new Response('OK', { status: 200 });
+  }
+  return null;
+}
+
+// ═══════════════════════════════════════════════════════════════
+// Webhook Google Calendar - Sincronizar cambios Google → CRM
+// ═══════════════════════════════════════════════════════════════
+async function handleGoogleCalendarWebhook({ url, request, env, supabase }: RouteContext): Promise<Response | null> {
+  try {
+    const channelId = request.headers.get('X-Goog-Channel-ID');
+    const resourceState = request.headers.get('X-Goog-Resource-State');
+
+    console.log('📅 Google Calendar Webhook:', resourceState, channelId);
+
+    // Solo procesar si hay cambios (no sync inicial)
+    if (resourceState === 'exists' || resourceState === 'update') {
+      console.log('📅 Procesando cambios de Google Calendar...');
+      // TODO Phase 3b: resolve tenant from calendar webhook (e.g. by channel_id or calendar_id)
+      const calendar = new CalendarService(env.GOOGLE_SERVICE_ACCOUNT_EMAIL, env.GOOGLE_PRIVATE_KEY, env.GOOGLE_CALENDAR_ID);
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
 
-    // STATUS: Ver estado de todos los CRONs
-    // ═══════════════════════════════════════════════════════════════
-    if (url.pathname === '/cron-status') {
+      // Obtener eventos de las últimas 24 horas y próximos 30 días
       const now = new Date();
-      // Usar timezone correcto de México (maneja DST automáticamente)
-      const mexicoFormatter = new Intl.DateTimeFormat('en-US', {
-        timeZone: 'America/Mexico_City',
-        hour: 'numeric',
-        minute: 'numeric',
-        weekday: 'short',
-        hour12: false
-      });
-      const mexicoParts = mexicoFormatter.formatToParts(now);
-      const mexicoHour = parseInt(mexicoParts.find(p => p.type === 'hour')?.value || '0');
-      const mexicoMinute = parseInt(mexicoParts.find(p => p.type === 'minute')?.value || '0');
-      const mexicoWeekday = mexicoParts.find(p => p.type === 'weekday')?.value || '';
-      const dayMap: Record<string, number> = { 'Sun': 0, 'Mon': 1, 'Tue': 2, 'Wed': 3, 'Thu': 4, 'Fri': 5, 'Sat': 6 };
-      const dayOfWeek = dayMap[mexicoWeekday] ?? now.getUTCDay();
-      const dayNames = ['Domingo', 'Lunes', 'Martes', 'Miercoles', 'Jueves', 'Viernes', 'Sabado'];
-      
-      const crons = [
-        { name: '📋 BRIEFING CONSOLIDADO', hora: '8:00', dias: 'L-V', desc: 'Citas + Leads pendientes + Hipotecas + Cumples + Promos' },
-        { name: 'Reporte diario CEO', hora: '8:00', dias: 'L-V' },
-        { name: 'Reporte semanal CEO', hora: '8:00', dias: 'Lunes' },
-        { name: 'Reporte mensual CEO', hora: '8:00', dias: 'Dia 1' },
-        { name: 'Alertas proactivas CEO', hora: '8:00', dias: 'L-V' },
-        { name: 'Felicitaciones cumple', hora: '9:00', dias: 'Diario' },
-        { name: 'Video semanal', hora: '18:00', dias: 'Viernes' },
-        { name: 'Recap diario', hora: '19:00', dias: 'L-V' },
-        { name: 'Recap semanal', hora: '12:00', dias: 'Sabado' },
-        { name: 'Recordatorios citas', hora: 'c/2min', dias: 'Siempre' },
-        { name: 'Follow-ups automáticos', hora: 'c/2min', dias: 'Siempre' },
-        { name: 'Videos pendientes', hora: 'c/2min', dias: 'Siempre' },
-        { name: 'Remarketing fríos', hora: '8:00', dias: 'Miércoles' },
-        { name: 'Seguimiento hipotecas', hora: '8:00', dias: 'Mar/Jue' },
-        // POST-COMPRA
-        { name: '🔑 Seguimiento post-entrega', hora: '10:00', dias: 'Lun/Jue', desc: '3-7 días después de entrega' },
-        { name: '🏡 Satisfacción casa', hora: '11:00', dias: 'Martes', desc: '3-6 meses post-entrega' },
-        { name: '🔧 Check-in mantenimiento', hora: '10:00', dias: 'Sábado', desc: '~1 año post-entrega' },
-        { name: '🤝 Solicitud referidos', hora: '11:00', dias: 'Miércoles', desc: '30-90 días post-venta' },
-        { name: '📊 Encuestas NPS', hora: '10:00', dias: 'Viernes', desc: '7-30 días post-visita/compra' },
-        { name: '🎉 Aniversarios compra', hora: '9:00', dias: 'L-V', desc: 'Cada año' },
-      ];
+      const yesterday = new Date(now.getTime() - 24 * 60 * 60 * 1000);
+      const nextMonth = new Date(now.getTime() + 30 * 24 * 60 * 60 * 1000);
 
-      return corsResponse(JSON.stringify({
-        ok: true,
-        hora_mexico: mexicoHour + ':' + mexicoMinute.toString().padStart(2, '0'),
-        dia: dayNames[dayOfWeek],
-        crons: crons,
-        endpoints_test: [
-          '/test-reporte-diario',
-          '/test-reporte-semanal',
-          '/test-reporte-mensual',
-          '/test-alertas-proactivas',
-          '/test-alerta-hot',
-          '/test-coaching',
-          '/test-briefing',
-          '/test-followups',
-          '/test-video-semanal',
-          '/test-remarketing',
-          '/test-hipotecas',
-          '/run-post-entrega',
-          '/run-satisfaccion-casa',
-          '/run-mantenimiento',
-          '/run-referidos',
-          '/run-nps',
-          '/run-health-monitor',
-          '/test-monthly-email-report?preview=1',
-          '/test-monthly-email-report?type=weekly&preview=1',
-          '/health',
-          '/backup',
-          '/ab-results'
-        ]
-      }));
-    }
+      const events = await calendar.getEvents(yesterday.toISOString(), nextMonth.toISOString());
+      const googleEventIds = events.map((e: any) => e.id);
+      console.log(`📅 Eventos en Google Calendar: ${events.length}, IDs: ${googleEventIds.slice(0, 5).join(', ')}...`);
 
-    // ═══════════════════════════════════════════════════════════
-    // LOAD TEST: Simula N leads concurrentes (NO envía WhatsApp real)
-    // POST /test-load-test?concurrent=20&api_key=XXX
-    // ═══════════════════════════════════════════════════════════
-    if (url.pathname === '/test-load-test' && request.method === 'POST') {
-      const concurrent = parseInt(url.searchParams.get('concurrent') || '10');
-      const maxConcurrent = Math.min(concurrent, 50); // Cap at 50
+      // 1. DETECTAR EVENTOS ELIMINADOS: Buscar citas que tienen google_event_id pero ya no existen en Google
+      // IMPORTANTE: Solo verificar citas dentro del rango de fechas que consultamos a Google
+      const yesterdayStr = yesterday.toISOString().split('T')[0];
+      const nextMonthStr = nextMonth.toISOString().split('T')[0];
 
-      const claude = new ClaudeService(env.ANTHROPIC_API_KEY);
-      const loadTestMeta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
-      const aiService = new AIConversationService(supabase, null, loadTestMeta, null, claude, env);
+      // ✅ FIX 14-ENE-2026: También detectar citas completadas que fueron borradas del calendario
+      // ✅ FIX 15-ENE-2026: Incluir canceladas para poder verificar si Sara ya canceló
+      const { data: citasConGoogle } = await supabase.client
+        .from('appointments')
+        .select('*')
+        .not('google_event_vendedor_id', 'is', null)
+        .in('status', ['scheduled', 'completed', 'cancelled']) // Incluir canceladas para verificar
+        .gte('scheduled_date', yesterdayStr)  // Solo citas desde ayer
+        .lte('scheduled_date', nextMonthStr); // Hasta próximo mes
+
+      console.log(`📅 Citas con google_event_vendedor_id en BD: ${citasConGoogle?.length || 0}`);
+      if (citasConGoogle && citasConGoogle.length > 0) {
+        console.log(`📅 IDs de eventos en citas: ${citasConGoogle.map(c => c.google_event_vendedor_id?.substring(0,15)).join(', ')}`);
+      }
 
-      // Obtener propiedades para contexto
-      const { data: props } = await supabase.client.from('properties').select('*').limit(50);
-      const properties = props || [];
+      if (citasConGoogle) {
+        for (const cita of citasConGoogle) {
+          if (cita.google_event_vendedor_id && !googleEventIds.includes(cita.google_event_vendedor_id)) {
+            // El evento fue eliminado de Google Calendar
 
-      const desarrollos = ['Monte Verde', 'Los Encinos', 'Distrito Falco', 'Andes', 'Miravalle'];
-      const mensajes = [
-        'hola busco casa de 3 recamaras',
-        'que tienen en {desarrollo}',
-        'quiero agendar cita el sabado a las 11'
-      ];
+            // ═══ FIX: Ignorar citas ya procesadas por Sara ═══
+            if (cita.status === 'rescheduled') {
+              console.log(`📅 Evento eliminado pero cita ya reagendada, ignorando: ${cita.id}`);
+              continue;
+            }
+            if (cita.status === 'cancelled') {
+              console.log(`📅 Evento eliminado pero cita ya cancelada por Sara, ignorando: ${cita.id}`);
+              continue;
+            }
 
-      const results: Array<{ leadId: number; step: string; success: boolean; time_ms: number; error?: string }> = [];
-      const startTime = Date.now();
+            // Solo actualizar BD - NO enviar notificaciones (Sara se encarga de eso)
+            const eraCompletada = cita.status === 'completed';
+            console.log(`📅 Evento eliminado de Google, actualizando BD: ${cita.id} (era: ${cita.status})`);
 
-      // Simular leads concurrentes
-      const promises = Array.from({ length: maxConcurrent }, async (_, i) => {
-        const leadNum = i + 1;
-        const desarrollo = desarrollos[i % desarrollos.length];
+            await supabase.client
+              .from('appointments')
+              .update({
+                status: 'cancelled',
+                cancelled_by: eraCompletada ? 'Google Calendar (eliminado post-visita)' : 'Google Calendar (eliminado)',
+              })
+              .eq('id', cita.id);
 
-        for (const msgTemplate of mensajes) {
-          const msg = msgTemplate.replace('{desarrollo}', desarrollo);
-          const stepStart = Date.now();
+            console.log(`📅 Cita ${cita.id} marcada como cancelada (sin notificaciones - Sara se encarga)`);
+          }
+        }
+      }
 
-          try {
-            const fakeLead = {
-              id: `load-test-${leadNum}`,
-              name: `Lead Test ${leadNum}`,
-              phone: `521000000${String(leadNum).padStart(4, '0')}`,
-              status: 'new',
-              score: 0,
-              notes: {},
-              conversation_history: [],
-              property_interest: null,
-              assigned_to: null
-            };
+      // 2. PROCESAR CAMBIOS EN EVENTOS EXISTENTES
+      for (const event of events) {
+        // Buscar cita en DB por google_event_id
+        const { data: appointment } = await supabase.client
+          .from('appointments')
+          .select('*')
+          .eq('google_event_vendedor_id', event.id)
+          .maybeSingle();
+
+        if (appointment) {
+          // Verificar si el evento fue cancelado (marcado como cancelled en Google)
+          if (event.status === 'cancelled') {
+            // Solo procesar si no estaba ya cancelado
+            if (appointment.status !== 'cancelled') {
+              await supabase.client
+                .from('appointments')
+                .update({ 
+                  status: 'cancelled', 
+                  cancelled_by: 'Google Calendar',
+                })
+                .eq('id', appointment.id);
+              console.log('📅 Cita cancelada desde Google:', appointment.id);
 
-            const analysis = await aiService.analyzeWithAI(msg, fakeLead, properties);
-            const elapsed = Date.now() - stepStart;
+              // Notificar al LEAD por WhatsApp
+              if (appointment.lead_phone) {
+                try {
+                  const fechaStr = new Date(appointment.scheduled_date + 'T12:00:00').toLocaleDateString('es-MX', { weekday: 'long', day: 'numeric', month: 'long' });
+                  const msgLead = `❌ *CITA CANCELADA*\n\nHola ${appointment.lead_name?.split(' ')[0] || ''} 👋\n\nTu cita del ${fechaStr} a las ${(appointment.scheduled_time || '').substring(0,5)} ha sido cancelada.\n\nSi deseas reagendar, contáctanos. ¡Estamos para servirte! 🏠`;
+                  const phoneLead = appointment.lead_phone.replace(/[^0-9]/g, '');
+                  await meta.sendWhatsAppMessage(phoneLead, msgLead);
+                  console.log('📤 Notificación cancelación (Google→WhatsApp) a lead:', appointment.lead_name);
+                } catch (e) {
+                  console.error('⚠️ Error notificando lead:', e);
+                }
+              }
+            }
+          } else {
+            // Actualizar fecha/hora si cambió
+            const dateTimeStr = event.start?.dateTime || event.start?.date || '';
+            const newDate = dateTimeStr.substring(0, 10);
+            const newTime = dateTimeStr.substring(11, 16);
+
+            if (newDate && newTime && (appointment.scheduled_date !== newDate || (appointment.scheduled_time || '').substring(0,5) !== newTime)) {
+              const oldDate = appointment.scheduled_date;
+              const oldTime = (appointment.scheduled_time || '').substring(0,5);
+
+              // ═══ VERIFICAR SI SARA YA REAGENDÓ (evitar duplicados) ═══
+              // Verificar si las notas indican que Sara ya reagendó a esta fecha/hora
+              const notes = appointment.notes || '';
+              if (notes.includes('Reagendada') && notes.includes('→')) {
+                // Formato: "Reagendada de 2026-01-16 10:00 → 2026-01-16 11:15"
+                const partes = notes.split('→');
+                if (partes.length >= 2) {
+                  const destino = partes[1].trim(); // "2026-01-16 11:15"
+                  if (destino.includes(newDate) && destino.includes(newTime)) {
+                    console.log('📅 Webhook Calendar: Ignorando - Sara ya reagendó a', destino);
+                    continue; // Saltar notificaciones, Sara ya las envió
+                  }
+                }
+              }
 
-            results.push({
-              leadId: leadNum,
-              step: msg.substring(0, 40),
-              success: !!analysis?.response,
-              time_ms: elapsed
-            });
-          } catch (err: any) {
-            results.push({
-              leadId: leadNum,
-              step: msg.substring(0, 40),
-              success: false,
-              time_ms: Date.now() - stepStart,
-              error: err.message?.substring(0, 100)
-            });
+              // Solo actualizar BD - NO enviar notificaciones (Sara ya las envía)
+              await supabase.client
+                .from('appointments')
+                .update({
+                  scheduled_date: newDate,
+                  scheduled_time: newTime,
+                  property_name: event.location || appointment.property_name,
+                })
+                .eq('id', appointment.id);
+              console.log('📅 Cita sincronizada desde Google Calendar:', appointment.id, newDate, newTime);
+              console.log('📅 (Sin notificaciones - Sara ya las envió)');
+            }
           }
         }
-      });
+      }
+    }
 
-      await Promise.all(promises);
+    return new Response('OK', { status: 200 });
+  } catch (error) {
+    console.error('Google Calendar Webhook Error:', error);
+    return new Response('OK', { status: 200 });
+  }
+  return null;
+}
+
+// ═══════════════════════════════════════════════════════════════
+// A/B TEST RESULTS - Ver resultados
+// ═══════════════════════════════════════════════════════════════
+async function handleABResults({ url, supabase }: RouteContext): Promise<Response | null> {
+  const testName = url.searchParams.get('test') || 'welcome_message';
+  const results = await getABTestResults(supabase, testName);
+  return corsResponse(JSON.stringify(results || { error: 'No results found' }));
+}
+
+// ═══════════════════════════════════════════════════════════════
+// STATUS: Ver estado de todos los CRONs
+// ═══════════════════════════════════════════════════════════════
+async function handleCronStatus({ url }: RouteContext): Promise<Response | null> {
+  const now = new Date();
+  // Usar timezone correcto de México (maneja DST automáticamente)
+  const mexicoFormatter = new Intl.DateTimeFormat('en-US', {
+    timeZone: 'America/Mexico_City',
+    hour: 'numeric',
+    minute: 'numeric',
+    weekday: 'short',
+    hour12: false
+  });
+  const mexicoParts = mexicoFormatter.formatToParts(now);
+  const mexicoHour = parseInt(mexicoParts.find(p => p.type === 'hour')?.value || '0');
+  const mexicoMinute = parseInt(mexicoParts.find(p => p.type === 'minute')?.value || '0');
+  const mexicoWeekday = mexicoParts.find(p => p.type === 'weekday')?.value || '';
+  const dayMap: Record<string, number> = { 'Sun': 0, 'Mon': 1, 'Tue': 2, 'Wed': 3, 'Thu': 4, 'Fri': 5, 'Sat': 6 };
+  const dayOfWeek = dayMap[mexicoWeekday] ?? now.getUTCDay();
+  const dayNames = ['Domingo', 'Lunes', 'Martes', 'Miercoles', 'Jueves', 'Viernes', 'Sabado'];
+
+  const crons = [
+    { name: '📋 BRIEFING CONSOLIDADO', hora: '8:00', dias: 'L-V', desc: 'Citas + Leads pendientes + Hipotecas + Cumples + Promos' },
+    { name: 'Reporte diario CEO', hora: '8:00', dias: 'L-V' },
+    { name: 'Reporte semanal CEO', hora: '8:00', dias: 'Lunes' },
+    { name: 'Reporte mensual CEO', hora: '8:00', dias: 'Dia 1' },
+    { name: 'Alertas proactivas CEO', hora: '8:00', dias: 'L-V' },
+    { name: 'Felicitaciones cumple', hora: '9:00', dias: 'Diario' },
+    { name: 'Video semanal', hora: '18:00', dias: 'Viernes' },
+    { name: 'Recap diario', hora: '19:00', dias: 'L-V' },
+    { name: 'Recap semanal', hora: '12:00', dias: 'Sabado' },
+    { name: 'Recordatorios citas', hora: 'c/2min', dias: 'Siempre' },
+    { name: 'Follow-ups automáticos', hora: 'c/2min', dias: 'Siempre' },
+    { name: 'Videos pendientes', hora: 'c/2min', dias: 'Siempre' },
+    { name: 'Remarketing fríos', hora: '8:00', dias: 'Miércoles' },
+    { name: 'Seguimiento hipotecas', hora: '8:00', dias: 'Mar/Jue' },
+    // POST-COMPRA
+    { name: '🔑 Seguimiento post-entrega', hora: '10:00', dias: 'Lun/Jue', desc: '3-7 días después de entrega' },
+    { name: '🏡 Satisfacción casa', hora: '11:00', dias: 'Martes', desc: '3-6 meses post-entrega' },
+    { name: '🔧 Check-in mantenimiento', hora: '10:00', dias: 'Sábado', desc: '~1 año post-entrega' },
+    { name: '🤝 Solicitud referidos', hora: '11:00', dias: 'Miércoles', desc: '30-90 días post-venta' },
+    { name: '📊 Encuestas NPS', hora: '10:00', dias: 'Viernes', desc: '7-30 días post-visita/compra' },
+    { name: '🎉 Aniversarios compra', hora: '9:00', dias: 'L-V', desc: 'Cada año' },
+  ];
+
+  return corsResponse(JSON.stringify({
+    ok: true,
+    hora_mexico: mexicoHour + ':' + mexicoMinute.toString().padStart(2, '0'),
+    dia: dayNames[dayOfWeek],
+    crons: crons,
+    endpoints_test: [
+      '/test-reporte-diario',
+      '/test-reporte-semanal',
+      '/test-reporte-mensual',
+      '/test-alertas-proactivas',
+      '/test-alerta-hot',
+      '/test-coaching',
+      '/test-briefing',
+      '/test-followups',
+      '/test-video-semanal',
+      '/test-remarketing',
+      '/test-hipotecas',
+      '/run-post-entrega',
+      '/run-satisfaccion-casa',
+      '/run-mantenimiento',
+      '/run-referidos',
+      '/run-nps',
+      '/run-health-monitor',
+      '/test-monthly-email-report?preview=1',
+      '/test-monthly-email-report?type=weekly&preview=1',
+      '/health',
+      '/backup',
+      '/ab-results'
+    ]
+  }));
+  return null;
+}
 
-      const totalTime = Date.now() - startTime;
-      const successResults = results.filter(r => r.success);
-      const failedResults = results.filter(r => !r.success);
-      const times = successResults.map(r => r.time_ms);
-      const avgTime = times.length > 0 ? Math.round(times.reduce((a, b) => a + b, 0) / times.length) : 0;
-      const maxTime = times.length > 0 ? Math.max(...times) : 0;
-      const minTime = times.length > 0 ? Math.min(...times) : 0;
 
-      return corsResponse(JSON.stringify({
-        ok: true,
-        concurrent: maxConcurrent,
-        total_requests: results.length,
-        success: successResults.length,
-        failed: failedResults.length,
-        total_time_ms: totalTime,
-        avg_response_ms: avgTime,
-        min_response_ms: minTime,
-        max_response_ms: maxTime,
-        errors: failedResults.map(r => ({ lead: r.leadId, step: r.step, error: r.error }))
-      }));
+export default {
+  async fetch(request: Request, env: Env, ctx: ExecutionContext): Promise<Response> {
+    // Preflight CORS: sin Sentry ni servicios
+    if (request.method === 'OPTIONS') {
+      return corsResponse(null, 204, 'application/json', request);
+    }
+    setTenantJwtSecret(env.SUPABASE_JWT_SECRET);
+
+    const url = new URL(request.url);
+    const requestId = generateRequestId();
+
+    // Inicializar Sentry para error tracking
+    const sentry = initSentry(request, env, ctx);
+    sentry.setTag('request_id', requestId);
+    sentry.setTag('path', url.pathname);
+    sentry.addBreadcrumb({
+      message: `${request.method} ${url.pathname}`,
+      category: 'http',
+      level: 'info',
+      data: { method: request.method, path: url.pathname }
+    });
+
+    // Log incoming request
+    log('info', `${request.method} ${url.pathname}`, requestId, {
+      method: request.method,
+      path: url.pathname,
+      ip: request.headers.get('CF-Connecting-IP') || 'unknown'
+    });
+
+    // Servicios lazy del request (Supabase, Cache, Meta...): cada handler construye lo que usa
+    const services = new RequestServices(env, ctx);
+
+    try {
+
+    // ═══════════════════════════════════════════════════════════
+    // ROUTING: tabla compilada (ROUTES). El rate limit (req/min por IP)
+    // y la auth salen de las rutas que matchean el path
+    // ═══════════════════════════════════════════════════════════
+    const candidates = router.match(url.pathname);
+    const policy = routePolicy(candidates);
+    const limits = RATE_LIMIT_CLASSES[policy.rateLimit];
+    const rateLimitError = await checkRateLimit(request, env, requestId, limits.max, limits.failClosed, ctx);
+    if (rateLimitError) return rateLimitError;
+
+    // ═══════════════════════════════════════════════════════════
+    // SEGURIDAD: Verificar autenticación para rutas protegidas
+    // ═══════════════════════════════════════════════════════════
+    if (policy.auth === 'api_key' || (policy.auth === 'path' && requiresAuth(url.pathname))) {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+    }
+
+    // Resolve tenant for API requests (JWT tenantId claim, X-Tenant-ID header
+    // only with API_SECRET, or default Santa Rita)
+    if (url.pathname.startsWith('/api/')) {
+      const supabase = services.getSupabase();
+      const apiTenant = await resolveTenantFromRequest(request, supabase, getJWTSecret(env.API_SECRET), hasValidApiKey(request, env));
+      await supabase.setTenant(apiTenant.tenantId);
     }
 
+    const routeContext: RouteContext = {
+      url, request, env, ctx, requestId, services,
+      get supabase() { return services.getSupabase(); },
+      get cache() { return services.getCache(); },
+    };
+    const routeResp = await router.dispatch(candidates, request.method, routeContext);
+    if (routeResp) return routeResp;
+
     return corsResponse(JSON.stringify({ error: 'Not Found' }), 404);
     } catch (error) {
       // Capturar error en Sentry con contexto completo
@@ -2556,10 +2399,9 @@ export default {
       // Track error in KV for rate monitoring
       ctx.waitUntil(trackError(env, 'fetch_error'));
 
-      // Persist to error_logs (create new supabase instance since the one in try block is out of scope)
+      // Persist to error_logs
       try {
-        const errorSupabase = new SupabaseService(env.SUPABASE_URL, env.SUPABASE_ANON_KEY);
-        ctx.waitUntil(logErrorToDB(errorSupabase, 'fetch_error', error instanceof Error ? error.message : String(error), {
+        ctx.waitUntil(logErrorToDB(services.getSupabase(), 'fetch_error', error instanceof Error ? error.message : String(error), {
           severity: 'critical',
           source: `fetch:${url.pathname}`,
           stack: error instanceof Error ? error.stack : undefined,
@@ -2571,6 +2413,21 @@ export default {
         error: 'Internal Server Error',
         request_id: requestId
       }), 500, 'application/json', request);
+    } finally {
+      services.finish(url.pathname);
+    }
+  },
+
+  // ═══════════════════════════════════════════════════════════
+  // CONSUMIDOR: cola de ingesta del webhook Meta (META_INBOUND_QUEUE)
+  // ═══════════════════════════════════════════════════════════
+  async queue(batch: MessageBatch<InboundEvent>, env: Env, ctx: ExecutionContext): Promise<void> {
+    setTenantJwtSecret(env.SUPABASE_JWT_SECRET);
+    // Los eventos cuyo handler lanzó vuelven a la cola; el resto se confirma
+    const failed = new Set(await metaInboundConsumer(env, ctx)(batch.messages.map(m => m.body)));
+    for (const message of batch.messages) {
+      if (failed.has(message.body)) message.retry();
+      else message.ack();
     }
   },
 
@@ -2578,6 +2435,14 @@ export default {
   // CRON JOBS - Mensajes automáticos
   // ═══════════════════════════════════════════════════════════
   async scheduled(event: ScheduledEvent, env: Env, ctx: ExecutionContext): Promise<void> {
+    // Subrequest governor: cuenta fetch/Supabase/KV/R2 de toda la invocación (límite 1000)
+    // Se instala ANTES de crear SupabaseService para que supabase-js use el fetch contado
+    const governor = new SubrequestGovernor();
+    governor.install();
+    env = governor.wrapEnv(env);
+    setTenantJwtSecret(env.SUPABASE_JWT_SECRET);
+    try {
+
     // Inicializar Sentry para cron jobs
     const cronRequest = new Request('https://cron.internal/scheduled');
     const sentry = initSentry(cronRequest, env, ctx);
@@ -2599,9 +2464,12 @@ export default {
     await supabase.setTenant(cronTenant.tenantId);
     console.log(`\n🏢 [${tenantIdx + 1}/${cronTenants.length}] Processing tenant: ${cronTenant.name} (${cronTenant.tenantId})`);
 
+    // messages_sent del tenant: buffer en memoria, flush multi-row (se vacía antes de pasar al siguiente tenant)
+    const trackingBuffer = createRequestTrackingBuffer(supabase, ctx);
+
     try {
     // Use tenant config for Meta/Calendar (falls back to env vars if not configured)
-    const meta = await createMetaWithTracking(env, supabase, cronTenant.config);
+    const meta = await createMetaWithTracking(env, supabase, cronTenant.config, trackingBuffer);
     const cronCalendar = new CalendarService(
       cronTenant.config.googleServiceAccountEmail || env.GOOGLE_SERVICE_ACCOUNT_EMAIL,
       cronTenant.config.googlePrivateKey || env.GOOGLE_PRIVATE_KEY,
@@ -2662,15 +2530,19 @@ export default {
     }
 
     // Obtener vendedores activos
-    const { data: vendedores, error: vendedoresError } = await supabase.client
-      .from('team_members')
-      .select('*')
-      .eq('active', true);
+    // Fresco de DB (ventana 24h en notes); deja las filas en el identity map del CRON
+    let vendedores: any[] | null = null;
+    let vendedoresError: unknown = null;
+    try {
+      vendedores = await getEntityCache(supabase, env.SARA_CACHE, (p) => ctx.waitUntil(p)).getTeamMembers({ fresh: true });
+    } catch (err) {
+      vendedoresError = err;
+    }
 
     // CronTracker: tracks execution time + errors for each CRON task
-    const cronTracker = new CronTracker(event.cron);
-    async function safeCron(label: string, fn: () => Promise<any>): Promise<void> {
-      await cronTracker.track(label, fn);
+    const cronTracker = new CronTracker(event.cron, governor);
+    async function safeCron(label: string, fn: () => Promise<any>, options?: CronTaskBudgetOptions): Promise<void> {
+      await cronTracker.track(label, fn, options);
     }
 
     console.log(`👥 Vendedores activos: ${vendedores?.length || 0}`);
@@ -2903,10 +2775,35 @@ export default {
     }
 
     // ═══════════════════════════════════════════════════════════
-    // BACKUP DIARIO - Corre con tareas nocturnas 1 AM UTC (7 PM México)
+    // BACKUP INCREMENTAL R2 - 1 AM UTC (7 PM México)
+    // Solo filas con updated_at posterior al último manifest; compacta
+    // en snapshot cada 7 deltas. Tiempo y bytes escalan con el churn del día.
+    // ═══════════════════════════════════════════════════════════
+    if (event.cron === '0 1 * * *' && env.SARA_BACKUPS) {
+      try {
+        const results = await createIncrementalBackup(supabase, env.SARA_BACKUPS).run();
+        const totalRows = results.reduce((n, r) => n + r.rows, 0);
+        const totalKB = Math.round(results.reduce((n, r) => n + r.storedBytes, 0) / 1024);
+        const failed = results.filter(r => r.error);
+        console.log(`💾 Backup incremental: ${totalRows} filas, ${totalKB} KB — ${results.map(r => `${r.table}:${r.mode}${r.compacted ? '+compact' : ''}`).join(', ')}`);
+
+        if (failed.length > 0 || now.getDay() === 1) {
+          await enviarAlertaSistema(meta,
+            `💾 BACKUP INCREMENTAL ${failed.length > 0 ? 'CON ERRORES' : 'COMPLETADO'}\n\n` +
+            results.map(r => `• ${r.table}: ${r.error ? '❌ ' + r.error : `${r.mode} ${r.rows} filas (${Math.round(r.storedBytes / 1024)} KB)`}`).join('\n'),
+            env, failed.length > 0 ? 'backup_error' : 'backup'
+          );
+        }
+      } catch (e) {
+        console.error('❌ Error en backup incremental:', e);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // BACKUP DIARIO KV - Solo si R2 no está configurado
     // Guarda backup en KV, mantiene últimos 7 días
     // ═══════════════════════════════════════════════════════════
-    if (event.cron === '0 1 * * *') {
+    if (event.cron === '0 1 * * *' && !env.SARA_BACKUPS) {
       console.log('💾 INICIANDO BACKUP DIARIO...');
       try {
         const backupDate = now.toISOString().split('T')[0]; // YYYY-MM-DD
@@ -3049,7 +2946,7 @@ export default {
       try {
         if (env.SARA_BACKUPS) {
           console.log('💾 Iniciando backup semanal R2...');
-          const result = await backupSemanalR2(supabase, env.SARA_BACKUPS);
+          const result = await backupSemanalR2(supabase, env.SARA_BACKUPS, { gzip: true });
           console.log(`✅ Backup R2: ${result.conversations.rows} convs, ${result.leads.rows} leads`);
           // Notificar al dev
           await enviarAlertaSistema(meta,
@@ -3066,6 +2963,34 @@ export default {
       }
     }
 
+    // ═══════════════════════════════════════════════════════════
+    // FORECAST: matrices de conversión + pronóstico del día (7 PM MX)
+    // Quedan en cache para "pronóstico" y /api/reports/forecast
+    // ═══════════════════════════════════════════════════════════
+    if (event.cron === '0 1 * * *' && env.SARA_CACHE) {
+      try {
+        const forecastCache = getCacheService(env.SARA_CACHE, (p) => ctx.waitUntil(p));
+        const forecast = await precomputeForecast(supabase, forecastCache);
+        console.log(`🔮 Forecast precalculado: pipeline $${forecast.total_pipeline_value}, ponderado $${forecast.weighted_forecast}`);
+      } catch (e) {
+        console.error('❌ Error precalculando forecast:', e);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // REPORTES PROGRAMADOS: un RPC por reporte (snapshot reusado si nada cambió)
+    // ═══════════════════════════════════════════════════════════
+    if (event.cron === '0 1 * * *') {
+      try {
+        const scheduled = await runScheduledReports(supabase);
+        if (scheduled.ran > 0 || scheduled.failed > 0) {
+          console.log(`📑 Reportes programados: ${scheduled.ran} (${scheduled.cached} sin cambios), ${scheduled.failed} fallidos`);
+        }
+      } catch (e) {
+        console.error('❌ Error en reportes programados:', e);
+      }
+    }
+
     // ═══════════════════════════════════════════════════════════
     // LIMPIEZA: Flags de encuestas expirados (>72h) - diario 7 PM MX
     // ═══════════════════════════════════════════════════════════
@@ -3123,12 +3048,8 @@ export default {
         const hace24h = new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString();
         const hoyReactivacion = new Date().toISOString().split('T')[0];
 
-        // Obtener team members activos que reciben briefings
-        const { data: miembros } = await supabase.client
-          .from('team_members')
-          .select('id, name, phone, notes')
-          .eq('active', true)
-          .eq('recibe_briefing', true);
+        // Team members activos que reciben briefings (roster fresco del inicio del CRON)
+        const miembros = (vendedores || []).filter((v: any) => v.recibe_briefing);
 
         let reactivados = 0;
         for (const m of miembros || []) {
@@ -3150,6 +3071,7 @@ export default {
                 .from('team_members')
                 .update({ notes: updatedNotes })
                 .eq('id', m.id);
+              getEntityCache(supabase).patchTeamMember(m.id, { notes: updatedNotes });
 
               // Enviar template de reactivación
               const nombre = m.name?.split(' ')[0] || 'amigo';
@@ -3238,12 +3160,18 @@ export default {
 
         // Procesar máximo 5 por CRON para evitar timeout
         const BATCH_SIZE = 5;
+        const BRIEFING_SUBREQUESTS = 10;
         const lote = pendientes.slice(0, BATCH_SIZE);
         let enviados = 0;
 
         console.log(`   🔄 Procesando lote de ${lote.length} (máx ${BATCH_SIZE} por CRON)`);
 
         for (const v of lote) {
+          // ~10 subrequests por briefing (template/mensaje + tracking + updates)
+          if (!governor.canAfford(BRIEFING_SUBREQUESTS)) {
+            console.warn(`   ⏭️ Presupuesto de subrequests bajo, ${v.name} queda para el siguiente CRON`);
+            break;
+          }
           console.log(`\n   ═══ PROCESANDO: ${v.name} ═══`);
           try {
             await enviarBriefingMatutino(supabase, meta, v, { openaiApiKey: env.OPENAI_API_KEY, prefetchedData });
@@ -3277,17 +3205,18 @@ export default {
 
     // 8am L-V: Reporte diario consolidado CEO/Admin (incluye supervisión + métricas)
     if (mexicoHour === 8 && isFirstRunOfHour && dayOfWeek >= 1 && dayOfWeek <= 5) {
-      await safeCron('enviarReporteDiarioConsolidadoCEO', () => enviarReporteDiarioConsolidadoCEO(supabase, meta));
+      await safeCron('enviarReporteDiarioConsolidadoCEO', () => enviarReporteDiarioConsolidadoCEO(supabase, meta), { priority: 'critical' });
     }
 
     // 8am LUNES: Reporte semanal CEO/Admin
     if (mexicoHour === 8 && isFirstRunOfHour && dayOfWeek === 1) {
-      await safeCron('enviarReporteSemanalCEO', () => enviarReporteSemanalCEO(supabase, meta));
+      await safeCron('enviarReporteSemanalCEO', () => enviarReporteSemanalCEO(supabase, meta), { priority: 'critical' });
     }
 
     // 8am LUNES: Digest semanal por EMAIL (HTML)
     if (mexicoHour === 8 && isFirstRunOfHour && dayOfWeek === 1) {
       await safeCron('enviarDigestSemanalEmail', async () => {
+        const { MonthlyEmailReportService } = await import('./services/monthlyEmailReportService');
         const emailReportService = new MonthlyEmailReportService(supabase, env);
         await emailReportService.sendWeeklyDigest();
       });
@@ -3394,12 +3323,13 @@ export default {
 
     // 8am DÍA 1 DE CADA MES: Reporte mensual CEO/Admin
     if (mexicoHour === 8 && isFirstRunOfHour && mexicoDayOfMonth === 1) {
-      await safeCron('enviarReporteMensualCEO', () => enviarReporteMensualCEO(supabase, meta));
+      await safeCron('enviarReporteMensualCEO', () => enviarReporteMensualCEO(supabase, meta), { priority: 'critical' });
     }
 
     // 8am DÍA 1 DE CADA MES: Reporte mensual ejecutivo por EMAIL (HTML profesional)
     if (mexicoHour === 8 && isFirstRunOfHour && mexicoDayOfMonth === 1) {
       await safeCron('enviarReporteMensualEmail', async () => {
+        const { MonthlyEmailReportService } = await import('./services/monthlyEmailReportService');
         const emailReportService = new MonthlyEmailReportService(supabase, env);
         await emailReportService.sendMonthlyReport();
       });
@@ -3576,11 +3506,7 @@ export default {
             if (notas.pre_noshow_alert_sent) continue;
 
             // Obtener vendedor
-            const { data: vendedor } = await supabase.client
-              .from('team_members')
-              .select('id, name, phone')
-              .eq('id', cita.team_member_id)
-              .maybeSingle();
+            const vendedor = await getEntityCache(supabase).getTeamMemberById(cita.team_member_id);
 
             // Obtener lead
             const { data: lead } = await supabase.client
@@ -3624,7 +3550,7 @@ export default {
     await safeCron('verificarTimeoutConfirmaciones', () => verificarTimeoutConfirmaciones(supabase, meta));
 
     // Verificar videos pendientes
-    await safeCron('verificarVideosPendientes', () => verificarVideosPendientes(supabase, meta, env));
+    await safeCron('verificarVideosPendientes', () => verificarVideosPendientes(supabase, meta, env), { priority: 'low' });
 
     // FOLLOW-UPS AUTOMÁTICOS
     await safeCron('followupService', async () => {
@@ -3657,7 +3583,7 @@ export default {
     }));
 
     // Expirar aprobaciones viejas (cada ejecución)
-    await safeCron('expirarAprobacionesViejas', () => approvalService.expirarAprobacionesViejas());
+    await safeCron('expirarAprobacionesViejas', () => approvalService.expirarAprobacionesViejas(), { priority: 'low' });
 
     // 10am L-V: Pedir status a vendedores sobre leads estancados
     if (mexicoHour === 10 && isFirstRunOfHour && dayOfWeek >= 1 && dayOfWeek <= 5) {
@@ -3906,11 +3832,11 @@ export default {
 
     // BRIEFS PRE-VISITA: Cada 2 min L-S 8am-8pm MX
     if (dayOfWeek >= 1 && dayOfWeek <= 6 && mexicoHour >= 8 && mexicoHour <= 20) {
-      await safeCron('enviarBriefsPreVisita', () => enviarBriefsPreVisita(supabase, meta));
+      await safeCron('enviarBriefsPreVisita', () => enviarBriefsPreVisita(supabase, meta), { priority: 'low' });
     }
 
     // PLAYBOOKS OBJECIONES: Cada 2 min (24/7, el servicio maneja timing)
-    await safeCron('ejecutarPlaybooksObjeciones', () => ejecutarPlaybooksObjeciones(supabase, meta));
+    await safeCron('ejecutarPlaybooksObjeciones', () => ejecutarPlaybooksObjeciones(supabase, meta), { priority: 'low' });
 
     // BRIDGES - Verificar bridges por expirar (cada 2 min)
     await safeCron('verificarBridgesPorExpirar', () => verificarBridgesPorExpirar(supabase, meta));
@@ -3919,7 +3845,7 @@ export default {
     await safeCron('procesarFollowupsPendientes', () => procesarFollowupsPendientes(supabase, meta));
 
     // BROADCAST QUEUE - Procesar broadcasts encolados (cada 2 min)
-    await safeCron('procesarBroadcastQueue', () => procesarBroadcastQueue(supabase, meta));
+    await safeCron('procesarBroadcastQueue', () => procesarBroadcastQueue(supabase, meta, n => governor.canAfford(n)), { priority: 'low', budget: 300 });
 
     // ═══════════════════════════════════════════════════════════
     // HEALTH CHECK - Verificar servicios externos (cada 10 min, offset :05)
@@ -3958,6 +3884,13 @@ export default {
       }
     }
 
+    // ═══════════════════════════════════════════════════════════
+    // MESSAGE QUEUE DRAIN - Reintentar templates fallidos por prioridad (cada 4 min)
+    // ═══════════════════════════════════════════════════════════
+    if (mexicoMinute % 4 === 2) {
+      await safeCron('drainMessageQueue', () => new MessageQueueService(supabase, meta, true).drainQueue());
+    }
+
     // ═══════════════════════════════════════════════════════════
     // DELIVERY CHECK - Verificar que mensajes al equipo llegaron (cada 10 min)
     // Detecta mensajes aceptados por Meta pero nunca entregados
@@ -4031,9 +3964,15 @@ export default {
         console.log('⏭️ Retell no configurado, saltando verificación de llamadas');
       }
     }
+    // Flush pending message tracking before persisting the summary
+    await trackingBuffer.flush();
+
     // Persist CRON execution summary for observability
     await cronTracker.persist(supabase);
     const cronSummary = cronTracker.getSummary();
+    if (cronSummary.deferredCount > 0) {
+      console.warn(`⏭️ CRON [${cronTenant.name}]: ${cronSummary.deferredCount} tasks deferred (subrequest budget)`);
+    }
     if (cronSummary.failCount > 0) {
       console.warn(`⚠️ CRON [${cronTenant.name}]: ${cronSummary.failCount}/${cronSummary.tasks.length} tasks failed (${cronSummary.totalDuration_ms}ms)`);
     } else {
@@ -4060,6 +3999,8 @@ export default {
         await alertOnCriticalError(supabase, meta, env, 'cron_error', error instanceof Error ? error.message : String(error), `cron:${event.cron}`);
       } catch (logErr) { console.error('⚠️ CRON error logging to DB failed:', logErr); }
 
+      await trackingBuffer.flush().catch(() => {});
+
       // Continue to next tenant instead of crashing
       if (tenantIdx < cronTenants.length - 1) {
         console.log(`⏭️ Continuing to next tenant after error...`);
@@ -4069,5 +4010,12 @@ export default {
     } // End of tenant loop
 
     console.log(`\n═══ CRON COMPLETE: Processed ${cronTenants.length} tenant(s) ═══`);
+    reportEntityCache(supabase, `cron ${event.cron}`);
+
+    } finally {
+      const budget = governor.getSummary();
+      console.log(`📡 Subrequests: ${budget.used}/${budget.limit} (fetch=${budget.byKind.fetch}, kv=${budget.byKind.kv}, r2=${budget.byKind.r2})${budget.deferred.length > 0 ? ` | diferidas: ${budget.deferred.join(', ')}` : ''}`);
+      governor.uninstall();
+    }
   },
 };
@@ -73,11 +73,23 @@ export async function createJWT(
   secret: string,
   expirySeconds: number = JWT_EXPIRY_SECONDS
 ): Promise<string> {
-  const now = Math.floor(Date.now() / 1000);
-  const fullPayload: JWTPayload = {
-    ...payload,
-    iat: now,
-    exp: now + expirySeconds,
+  return signClaims(payload, secret, expirySeconds);
+}
+
+/**
+ * Sign arbitrary claims as an HS256 JWT (iat/exp added).
+ * Also used for the worker-signed Supabase token (role + tenant_id claims).
+ */
+export async function signClaims(
+  claims: Record<string, unknown>,
+  secret: string,
+  expirySeconds: number,
+  nowSeconds: number = Math.floor(Date.now() / 1000)
+): Promise<string> {
+  const fullPayload = {
+    ...claims,
+    iat: nowSeconds,
+    exp: nowSeconds + expirySeconds,
   };
 
   const header = base64urlEncodeString(JSON.stringify({ alg: JWT_ALGORITHM, typ: 'JWT' }));
@@ -1,13 +1,17 @@
 // ═══════════════════════════════════════════════════════════════════════════
 // TENANT MIDDLEWARE — Resolves tenant context from request
 // Sources (in priority order):
-//   1. JWT auth header (future: Phase 2)
-//   2. Meta webhook phone_number_id
-//   3. API key → default tenant
+//   1. JWT auth header (tenantId claim)
+//   2. X-Tenant-ID header (only with a valid API_SECRET)
+//   3. Meta webhook phone_number_id
 //   4. Fallback: Santa Rita (backward compatibility)
+// Contexts are cached per isolate (bounded LRU + TTL). invalidateTenant()
+// drops a tenant right after its row is updated; other isolates pick up
+// the change once the TTL expires.
 // ═══════════════════════════════════════════════════════════════════════════
 
 import { SupabaseService } from '../services/supabase';
+import { authenticateRequest } from './auth';
 
 export const SANTA_RITA_TENANT_ID = '00000000-0000-0000-0000-000000000001';
 
@@ -39,9 +43,62 @@ export interface TenantConfig {
   maxMessagesPerDay?: number;
 }
 
-// Cache tenant lookups in-memory for the duration of a request
-// (Cloudflare Workers are short-lived, so this is safe)
-const tenantCache = new Map<string, TenantContext>();
+export const TENANT_CACHE_MAX_ENTRIES = 200;
+export const TENANT_CACHE_TTL_MS = 5 * 60 * 1000;
+
+/**
+ * Isolate-level tenant context cache. Map insertion order doubles as LRU
+ * order: a hit re-inserts the key, eviction drops the oldest.
+ */
+export class TenantContextCache {
+  private entries = new Map<string, { value: TenantContext; expiresAt: number }>();
+  private hits = 0;
+  private misses = 0;
+
+  constructor(private maxEntries: number = TENANT_CACHE_MAX_ENTRIES, private ttlMs: number = TENANT_CACHE_TTL_MS) {}
+
+  get(key: string): TenantContext | undefined {
+    const entry = this.entries.get(key);
+    if (!entry || entry.expiresAt <= Date.now()) {
+      if (entry) this.entries.delete(key);
+      this.misses++;
+      return undefined;
+    }
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    this.hits++;
+    return entry.value;
+  }
+
+  set(key: string, value: TenantContext): void {
+    this.entries.delete(key);
+    this.entries.set(key, { value, expiresAt: Date.now() + this.ttlMs });
+    while (this.entries.size > this.maxEntries) {
+      const oldest = this.entries.keys().next().value;
+      if (oldest === undefined) break;
+      this.entries.delete(oldest);
+    }
+  }
+
+  /** Drop every key (id:, phone:) that resolved to this tenant */
+  invalidate(tenantId: string): void {
+    for (const [key, entry] of this.entries) {
+      if (entry.value.tenantId === tenantId) this.entries.delete(key);
+    }
+  }
+
+  clear(): void {
+    this.entries.clear();
+    this.hits = 0;
+    this.misses = 0;
+  }
+
+  getStats(): { size: number; hits: number; misses: number } {
+    return { size: this.entries.size, hits: this.hits, misses: this.misses };
+  }
+}
+
+const tenantCache = new TenantContextCache();
 
 /**
  * Resolve tenant from Meta webhook phone_number_id
@@ -51,9 +108,8 @@ export async function resolveTenantFromWebhook(
   supabase: SupabaseService
 ): Promise<TenantContext> {
   const cacheKey = `phone:${phoneNumberId}`;
-  if (tenantCache.has(cacheKey)) {
-    return tenantCache.get(cacheKey)!;
-  }
+  const cached = tenantCache.get(cacheKey);
+  if (cached) return cached;
 
   // Look up tenant by phone_number_id
   const { data: tenant, error } = await supabase.client
@@ -82,18 +138,27 @@ export async function resolveTenantFromWebhook(
 }
 
 /**
- * Resolve tenant from API request (auth header or default)
+ * Resolve tenant from API request (JWT claim, X-Tenant-ID header or default)
+ * X-Tenant-ID only counts when the caller already passed the API_SECRET check
+ * (trustTenantHeader): the worker signs queries with that tenant_id, so an
+ * unauthenticated header would give access to another tenant's data.
  */
 export async function resolveTenantFromRequest(
   request: Request,
-  supabase: SupabaseService
+  supabase: SupabaseService,
+  jwtSecret?: string,
+  trustTenantHeader: boolean = false
 ): Promise<TenantContext> {
-  // Phase 2: Extract tenant from JWT
-  // const jwt = request.headers.get('Authorization')?.replace('Bearer ', '');
-  // if (jwt) { ... decode and extract tenantId ... }
+  // SaaS users: tenantId claim of the JWT
+  if (jwtSecret) {
+    const payload = await authenticateRequest(request, jwtSecret);
+    if (payload?.tenantId) {
+      return resolveTenantById(payload.tenantId, supabase);
+    }
+  }
 
-  // Check X-Tenant-ID header (for API clients)
-  const tenantIdHeader = request.headers.get('X-Tenant-ID');
+  // Check X-Tenant-ID header (API clients authenticated with API_SECRET)
+  const tenantIdHeader = trustTenantHeader ? request.headers.get('X-Tenant-ID') : null;
   if (tenantIdHeader) {
     return resolveTenantById(tenantIdHeader, supabase);
   }
@@ -110,9 +175,8 @@ export async function resolveTenantById(
   supabase: SupabaseService
 ): Promise<TenantContext> {
   const cacheKey = `id:${tenantId}`;
-  if (tenantCache.has(cacheKey)) {
-    return tenantCache.get(cacheKey)!;
-  }
+  const cached = tenantCache.get(cacheKey);
+  if (cached) return cached;
 
   const { data: tenant, error } = await supabase.client
     .from('tenants')
@@ -218,6 +282,17 @@ function mapTenantRow(row: any): TenantContext {
   };
 }
 
+/**
+ * Drop a tenant's cached context after updating its row
+ */
+export function invalidateTenant(tenantId: string): void {
+  tenantCache.invalidate(tenantId);
+}
+
+export function getTenantCacheStats(): { size: number; hits: number; misses: number } {
+  return tenantCache.getStats();
+}
+
 /**
  * Clear the in-memory tenant cache (for testing)
  */
@@ -33,11 +33,17 @@ import { createTeamDashboard } from '../services/teamDashboardService';
 import { createEmailReports } from '../services/emailReportsService';
 import { createFeatureFlags } from '../services/featureFlagsService';
 import { generateOpenAPISpec, generateSwaggerUI, generateReDocUI } from '../services/apiDocsService';
-import { getSystemStatus, getAnalyticsDashboard, renderStatusPage, renderAnalyticsPage, exportBackup } from '../crons/dashboard';
+import { getSystemStatus, getCachedAnalyticsDashboard, renderStatusPage, renderAnalyticsPage, streamBackup, exportBackup } from '../crons/dashboard';
 import { getObservabilityDashboard } from '../services/observabilityService';
+import { getRouteTimings } from '../utils/router';
+import { getRateLimiterStats, corsHeaders } from '../utils/middleware';
+import { getServiceConstructionStats } from '../services/ServiceFactory';
+import { getEntityCacheStats } from '../services/entityCache';
+import { getInboundStats } from '../services/inboundQueueService';
 import { buildCotizacionFromOffer, generateCotizacionHTML } from '../services/cotizacionService';
 import { DevelopmentFunnelService } from '../services/developmentFunnelService';
 import { ReferralService } from '../services/referralService';
+import { classifyUserMessage, addClassification, emptyIntentCounts, getIntentCounts } from '../services/conversationIntentService';
 
 import { isAllowedCrmOrigin } from './cors';
 import type { Env, CorsResponseFn, CheckApiAuthFn } from '../types/env';
@@ -59,6 +65,14 @@ function checkSensitiveAuth(request: Request, env: Env, corsResponse: CorsRespon
   }), 401);
 }
 
+/** RPC no desplegado todavía (migración pendiente) → usar cálculo legacy */
+function isMissingRpc(error: any): boolean {
+  return !!error && (error.code === 'PGRST202' || error.code === '42883');
+}
+
+// Dimensiones permitidas para /api/metrics/leads/aggregate (mismo whitelist que bi_lead_counts)
+const LEAD_AGGREGATE_DIMENSIONS = ['status', 'source', 'property_interest', 'assigned_to'];
+
 export async function handleApiBiRoutes(
   url: URL,
   request: Request,
@@ -76,15 +90,24 @@ export async function handleApiBiRoutes(
       const authErr = checkSensitiveAuth(request, env, corsResponse, checkApiAuth);
       if (authErr) return authErr;
 
-      // OPTIMIZADO: Solo seleccionar campo 'status' en lugar de '*'
-      const { data: leads } = await supabase.client.from('leads').select('status');
+      // GROUP BY status en la base: payload constante sin importar el # de leads
+      let statusCounts: Record<string, number> = {};
+      const { data: grouped, error: groupedError } = await supabase.client.rpc('bi_lead_counts', { p_dimension: 'status', p_since: null });
+      if (!groupedError) {
+        for (const row of grouped || []) statusCounts[row.key] = Number(row.count) || 0;
+      } else {
+        if (!isMissingRpc(groupedError)) console.error('⚠️ bi_lead_counts error:', groupedError.message);
+        const { data: leads } = await supabase.client.from('leads').select('status');
+        statusCounts = {};
+        for (const l of leads || []) statusCounts[l.status] = (statusCounts[l.status] || 0) + 1;
+      }
       const kpis = {
-        total: leads?.length || 0,
-        new: leads?.filter((l: any) => l.status === 'new').length || 0,
-        contacted: leads?.filter((l: any) => l.status === 'contacted').length || 0,
-        qualified: leads?.filter((l: any) => l.status === 'qualified').length || 0,
-        appointment_scheduled: leads?.filter((l: any) => l.status === 'appointment_scheduled').length || 0,
-        converted: leads?.filter((l: any) => l.status === 'converted').length || 0
+        total: Object.values(statusCounts).reduce((a, b) => a + b, 0),
+        new: statusCounts['new'] || 0,
+        contacted: statusCounts['contacted'] || 0,
+        qualified: statusCounts['qualified'] || 0,
+        appointment_scheduled: statusCounts['appointment_scheduled'] || 0,
+        converted: statusCounts['converted'] || 0
       };
       return corsResponse(JSON.stringify(kpis));
     }
@@ -100,93 +123,80 @@ export async function handleApiBiRoutes(
       const fechaInicio = new Date();
       fechaInicio.setDate(fechaInicio.getDate() - dias);
 
-      const { data: leads } = await supabase.client
-        .from('leads')
-        .select('id, name, status, score, created_at, conversation_history, property_interest, source')
-        .gte('created_at', fechaInicio.toISOString());
-
-      const { data: appointments } = await supabase.client
-        .from('appointments')
-        .select('id, lead_id, status, scheduled_date')
-        .gte('created_at', fechaInicio.toISOString());
-
-      // Calcular métricas
-      const leadsConHistorial = (leads || []).filter((l: any) => l.conversation_history?.length > 0);
-      const totalMensajes = leadsConHistorial.reduce((sum: number, l: any) => sum + (l.conversation_history?.length || 0), 0);
-      const mensajesUsuario = leadsConHistorial.reduce((sum: number, l: any) =>
-        sum + (l.conversation_history?.filter((m: any) => m.role === 'user').length || 0), 0);
-      const mensajesSara = leadsConHistorial.reduce((sum: number, l: any) =>
-        sum + (l.conversation_history?.filter((m: any) => m.role === 'assistant').length || 0), 0);
-
-      // Detectar intenciones en mensajes
-      const intenciones: Record<string, number> = {
-        saludo: 0,
-        precio: 0,
-        ubicacion: 0,
-        cita: 0,
-        credito: 0,
-        objecion: 0,
-        otro: 0
-      };
-
-      // Detectar objeciones
-      const objeciones: Record<string, number> = {
-        'muy caro': 0,
-        'no me interesa': 0,
-        'lo voy a pensar': 0,
-        'ya compré': 0,
-        'no me alcanza': 0
-      };
+      // 1) Conteos agregados en SQL (sin descargar conversation_history)
+      const { data: agg, error: aggError } = await supabase.client.rpc('bi_conversation_metrics', { p_since: fechaInicio.toISOString() });
+      // 2) Intenciones/objeciones desde contadores escritos al recibir cada mensaje
+      const counters = aggError ? null : await getIntentCounts(supabase, fechaInicio.toISOString().split('T')[0]);
 
-      leadsConHistorial.forEach((lead: any) => {
-        (lead.conversation_history || []).forEach((msg: any) => {
-          if (msg.role === 'user') {
-            const content = (msg.content || '').toLowerCase();
-
-            // Detectar intención
-            if (content.match(/hola|buenos|buenas|hi|hello/)) intenciones.saludo++;
-            else if (content.match(/precio|costo|cuanto|cuánto|presupuesto/)) intenciones.precio++;
-            else if (content.match(/donde|ubicación|ubicacion|gps|dirección/)) intenciones.ubicacion++;
-            else if (content.match(/cita|visita|ver|conocer|agendar/)) intenciones.cita++;
-            else if (content.match(/crédito|credito|infonavit|fovissste|banco|financ/)) intenciones.credito++;
-            else if (content.match(/caro|no me interesa|pensar|no gracias|no puedo/)) intenciones.objecion++;
-            else intenciones.otro++;
-
-            // Detectar objeciones específicas
-            if (content.includes('muy caro') || content.includes('caro')) objeciones['muy caro']++;
-            if (content.includes('no me interesa') || content.includes('no gracias')) objeciones['no me interesa']++;
-            if (content.includes('pensar') || content.includes('después')) objeciones['lo voy a pensar']++;
-            if (content.includes('ya compré') || content.includes('ya tengo casa')) objeciones['ya compré']++;
-            if (content.includes('no me alcanza') || content.includes('no tengo')) objeciones['no me alcanza']++;
-          }
-        });
-      });
+      let resumen: any;
+      let intentCounts = counters || emptyIntentCounts();
 
-      // Calcular conversiones
-      const statusCounts: Record<string, number> = {};
-      (leads || []).forEach((l: any) => {
-        statusCounts[l.status] = (statusCounts[l.status] || 0) + 1;
-      });
+      if (!aggError && agg) {
+        resumen = agg;
+      } else {
+        if (aggError && !isMissingRpc(aggError)) console.error('⚠️ bi_conversation_metrics error:', aggError.message);
 
-      // Fuentes de leads
-      const sourcesCounts: Record<string, number> = {};
-      (leads || []).forEach((l: any) => {
-        const source = l.source || 'desconocido';
-        sourcesCounts[source] = (sourcesCounts[source] || 0) + 1;
-      });
+        // Fallback legacy: calcular en memoria desde las filas
+        const { data: leads } = await supabase.client
+          .from('leads')
+          .select('id, name, status, score, created_at, conversation_history, property_interest, source')
+          .gte('created_at', fechaInicio.toISOString());
 
-      // Desarrollos más consultados
-      const desarrollosCounts: Record<string, number> = {};
-      (leads || []).forEach((l: any) => {
-        if (l.property_interest) {
-          desarrollosCounts[l.property_interest] = (desarrollosCounts[l.property_interest] || 0) + 1;
+        const { data: appointments } = await supabase.client
+          .from('appointments')
+          .select('id, lead_id, status, scheduled_date')
+          .gte('created_at', fechaInicio.toISOString());
+
+        const leadsConHistorial = (leads || []).filter((l: any) => l.conversation_history?.length > 0);
+        const porStatus: Record<string, number> = {};
+        const porFuente: Record<string, number> = {};
+        const desarrollosCounts: Record<string, number> = {};
+        intentCounts = emptyIntentCounts();
+        let mensajesUsuario = 0, mensajesSara = 0, totalMensajes = 0;
+
+        for (const l of leads || []) {
+          porStatus[l.status] = (porStatus[l.status] || 0) + 1;
+          const source = l.source || 'desconocido';
+          porFuente[source] = (porFuente[source] || 0) + 1;
+          if (l.property_interest) desarrollosCounts[l.property_interest] = (desarrollosCounts[l.property_interest] || 0) + 1;
         }
-      });
+        for (const lead of leadsConHistorial) {
+          totalMensajes += lead.conversation_history.length;
+          for (const msg of lead.conversation_history) {
+            if (msg.role === 'assistant') mensajesSara++;
+            if (msg.role === 'user') {
+              mensajesUsuario++;
+              addClassification(intentCounts, classifyUserMessage(msg.content || ''));
+            }
+          }
+        }
+
+        resumen = {
+          leads_total: leads?.length || 0,
+          con_conversacion: leadsConHistorial.length,
+          total_mensajes: totalMensajes,
+          mensajes_usuario: mensajesUsuario,
+          mensajes_sara: mensajesSara,
+          por_status: porStatus,
+          por_fuente: porFuente,
+          desarrollos_populares: Object.entries(desarrollosCounts)
+            .sort(([,a], [,b]) => (b as number) - (a as number))
+            .slice(0, 5)
+            .map(([nombre, count]) => ({ nombre, count })),
+          citas: {
+            total: appointments?.length || 0,
+            completadas: (appointments || []).filter((a: any) => a.status === 'completed').length,
+            no_show: (appointments || []).filter((a: any) => a.status === 'no_show').length,
+            canceladas: (appointments || []).filter((a: any) => a.status === 'cancelled').length
+          }
+        };
+      }
 
-      // Citas completadas vs no-shows
-      const citasCompletadas = (appointments || []).filter((a: any) => a.status === 'completed').length;
-      const citasNoShow = (appointments || []).filter((a: any) => a.status === 'no_show').length;
-      const citasCanceladas = (appointments || []).filter((a: any) => a.status === 'cancelled').length;
+      const totalLeads = Number(resumen.leads_total) || 0;
+      const conConversacion = Number(resumen.con_conversacion) || 0;
+      const totalMensajes = Number(resumen.total_mensajes) || 0;
+      const statusCounts: Record<string, number> = resumen.por_status || {};
+      const citas = resumen.citas || { total: 0, completadas: 0, no_show: 0, canceladas: 0 };
 
       const metrics = {
         periodo: `últimos ${dias} días`,
@@ -194,46 +204,71 @@ export async function handleApiBiRoutes(
         fecha_fin: new Date().toISOString().split('T')[0],
 
         leads: {
-          total: leads?.length || 0,
-          con_conversacion: leadsConHistorial.length,
-          sin_conversacion: (leads?.length || 0) - leadsConHistorial.length,
+          total: totalLeads,
+          con_conversacion: conConversacion,
+          sin_conversacion: totalLeads - conConversacion,
           por_status: statusCounts,
-          por_fuente: sourcesCounts
+          por_fuente: resumen.por_fuente || {}
         },
 
         conversaciones: {
           total_mensajes: totalMensajes,
-          mensajes_usuario: mensajesUsuario,
-          mensajes_sara: mensajesSara,
-          promedio_por_lead: leadsConHistorial.length > 0 ? Math.round(totalMensajes / leadsConHistorial.length) : 0
+          mensajes_usuario: Number(resumen.mensajes_usuario) || 0,
+          mensajes_sara: Number(resumen.mensajes_sara) || 0,
+          promedio_por_lead: conConversacion > 0 ? Math.round(totalMensajes / conConversacion) : 0
         },
 
-        intenciones: intenciones,
-        objeciones: objeciones,
+        intenciones: intentCounts.intenciones,
+        objeciones: intentCounts.objeciones,
 
-        desarrollos_populares: Object.entries(desarrollosCounts)
-          .sort(([,a], [,b]) => (b as number) - (a as number))
-          .slice(0, 5)
-          .map(([nombre, count]) => ({ nombre, count })),
+        desarrollos_populares: resumen.desarrollos_populares || [],
 
         citas: {
-          total: appointments?.length || 0,
-          completadas: citasCompletadas,
-          no_show: citasNoShow,
-          canceladas: citasCanceladas,
-          tasa_completacion: appointments?.length ? Math.round((citasCompletadas / appointments.length) * 100) : 0
+          total: citas.total,
+          completadas: citas.completadas,
+          no_show: citas.no_show,
+          canceladas: citas.canceladas,
+          tasa_completacion: citas.total ? Math.round((citas.completadas / citas.total) * 100) : 0
         },
 
         conversion: {
-          lead_a_cita: leads?.length ? Math.round((appointments?.length || 0) / leads.length * 100) : 0,
-          lead_a_visita: leads?.length ? Math.round((statusCounts['visited'] || 0) / leads.length * 100) : 0,
-          lead_a_venta: leads?.length ? Math.round(((statusCounts['sold'] || 0) + (statusCounts['delivered'] || 0)) / leads.length * 100) : 0
+          lead_a_cita: totalLeads ? Math.round((citas.total || 0) / totalLeads * 100) : 0,
+          lead_a_visita: totalLeads ? Math.round((statusCounts['visited'] || 0) / totalLeads * 100) : 0,
+          lead_a_venta: totalLeads ? Math.round(((statusCounts['sold'] || 0) + (statusCounts['delivered'] || 0)) / totalLeads * 100) : 0
         }
       };
 
       return corsResponse(JSON.stringify(metrics, null, 2));
     }
 
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    // GET /api/metrics/leads/aggregate?by=source&days=30
+    // Conteo de leads por dimensión (GROUP BY en la base)
+    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    if (url.pathname === '/api/metrics/leads/aggregate' && request.method === 'GET') {
+      const authErr = checkSensitiveAuth(request, env, corsResponse, checkApiAuth);
+      if (authErr) return authErr;
+
+      const by = url.searchParams.get('by') || 'status';
+      if (!LEAD_AGGREGATE_DIMENSIONS.includes(by)) {
+        return corsResponse(JSON.stringify({ error: `Dimensión inválida. Usa: ${LEAD_AGGREGATE_DIMENSIONS.join(', ')}` }), 400);
+      }
+      const days = parseInt(url.searchParams.get('days') || '0');
+      const since = days > 0 ? new Date(Date.now() - days * 24 * 60 * 60 * 1000).toISOString() : null;
+
+      const { data, error } = await supabase.client.rpc('bi_lead_counts', { p_dimension: by, p_since: since });
+      if (error) {
+        return corsResponse(JSON.stringify({ error: isMissingRpc(error) ? 'Agregación no disponible (migración 011 pendiente)' : error.message }), isMissingRpc(error) ? 501 : 500);
+      }
+      const counts: Record<string, number> = {};
+      let total = 0;
+      for (const row of data || []) {
+        counts[row.key] = Number(row.count) || 0;
+        total += counts[row.key];
+      }
+      return corsResponse(JSON.stringify({ by, days: days > 0 ? days : null, total, counts }));
+    }
+
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     // GET /api/metrics/quality - Reporte de calidad de respuestas SARA
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -2353,10 +2388,26 @@ CREATE INDEX idx_mds_updated ON message_delivery_status(updated_at);`
     // ═══════════════════════════════════════════════════════════════
     // BACKUP - Exportar datos
     // ═══════════════════════════════════════════════════════════════
+    // Default: JSONL en streaming (una fila por línea, {"table": ..., "row": ...}).
+    // ?format=json conserva el JSON de antes (en memoria) para clientes viejos.
     if (url.pathname === '/backup') {
-      console.log('📦 Generando backup...');
-      const backup = await exportBackup(supabase);
-      return corsResponse(JSON.stringify(backup));
+      if (url.searchParams.get('format') === 'json') {
+        console.log('📦 Generando backup (JSON)...');
+        const backup = await exportBackup(supabase);
+        return corsResponse(JSON.stringify(backup), 200, 'application/json', request);
+      }
+      console.log('📦 Generando backup (streaming JSONL)...');
+      const gzip = url.searchParams.get('gzip') === '1';
+      const { stream } = streamBackup(supabase, { gzip });
+      const fecha = new Date().toISOString().split('T')[0];
+      return new Response(stream, {
+        status: 200,
+        headers: {
+          ...corsHeaders(request),
+          'Content-Type': gzip ? 'application/gzip' : 'application/x-ndjson',
+          'Content-Disposition': `attachment; filename="backup-${fecha}.${gzip ? 'jsonl.gz' : 'jsonl'}"`
+        }
+      });
     }
 
     // ═══════════════════════════════════════════════════════════════
@@ -2364,7 +2415,7 @@ CREATE INDEX idx_mds_updated ON message_delivery_status(updated_at);`
     // ═══════════════════════════════════════════════════════════════
     if (url.pathname === '/analytics') {
       const period = url.searchParams.get('period') || '30';
-      const analytics = await getAnalyticsDashboard(supabase, parseInt(period));
+      const analytics = await getCachedAnalyticsDashboard(supabase, cache, parseInt(period) || 30);
 
       const acceptHeader = request.headers.get('Accept') || '';
       if (acceptHeader.includes('text/html')) {
@@ -2384,7 +2435,7 @@ CREATE INDEX idx_mds_updated ON message_delivery_status(updated_at);`
       const authErr = checkSensitiveAuth(request, env, corsResponse, checkApiAuth);
       if (authErr) return authErr;
       try {
-        const dashboard = await getObservabilityDashboard(supabase);
+        const dashboard = { ...await getObservabilityDashboard(supabase), routes: getRouteTimings(), ingest: getInboundStats(), rateLimit: getRateLimiterStats(), services: getServiceConstructionStats(), entities: getEntityCacheStats() };
         return corsResponse(JSON.stringify(dashboard, null, 2), 200, 'application/json', request);
       } catch (e) {
         return corsResponse(JSON.stringify({ error: 'Error generating observability dashboard' }), 500);
@@ -3694,10 +3745,9 @@ ${problemasRecientes.slice(-10).reverse().map(p => `<tr><td>${p.lead}</td><td st
       // GET /api/reports/weekly/html - Weekly report as HTML
       if (request.method === 'GET' && url.pathname === '/api/reports/weekly/html') {
         const config = reportService.getWeeklyReportConfig();
-        const data = await reportService.generateReportData(config);
-        const html = reportService.generateHTML(data);
 
-        return new Response(html, {
+        // Streaming por sección: la descarga arranca con el <head>
+        return new Response(reportService.streamHTML(config), {
           status: 200,
           headers: { 'Content-Type': 'text/html; charset=utf-8' }
         });
@@ -3706,10 +3756,9 @@ ${problemasRecientes.slice(-10).reverse().map(p => `<tr><td>${p.lead}</td><td st
       // GET /api/reports/monthly/html - Monthly report as HTML
       if (request.method === 'GET' && url.pathname === '/api/reports/monthly/html') {
         const config = reportService.getMonthlyReportConfig();
-        const data = await reportService.generateReportData(config);
-        const html = reportService.generateHTML(data);
 
-        return new Response(html, {
+        // Streaming por sección: la descarga arranca con el <head>
+        return new Response(reportService.streamHTML(config), {
           status: 200,
           headers: { 'Content-Type': 'text/html; charset=utf-8' }
         });
@@ -3767,8 +3816,8 @@ ${problemasRecientes.slice(-10).reverse().map(p => `<tr><td>${p.lead}</td><td st
             }), 400, 'application/json', request);
           }
 
-          const data = await reportService.generateReportData({
-            type: 'custom',
+          const reportConfig = {
+            type: 'custom' as const,
             title: config.title || 'Reporte Personalizado',
             start_date: config.start_date,
             end_date: config.end_date,
@@ -3781,17 +3830,18 @@ ${problemasRecientes.slice(-10).reverse().map(p => `<tr><td>${p.lead}</td><td st
             recipient_name: config.recipient_name,
             recipient_role: config.recipient_role,
             vendor_id: config.vendor_id
-          });
+          };
 
           const format = url.searchParams.get('format');
           if (format === 'html') {
-            const html = reportService.generateHTML(data);
-            return new Response(html, {
+            return new Response(reportService.streamHTML(reportConfig), {
               status: 200,
               headers: { 'Content-Type': 'text/html; charset=utf-8' }
             });
           }
 
+          const data = await reportService.generateReportData(reportConfig);
+
           if (format === 'whatsapp') {
             const message = reportService.formatForWhatsApp(data);
             return corsResponse(JSON.stringify({
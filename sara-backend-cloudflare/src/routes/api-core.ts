@@ -4,6 +4,7 @@
 // ═══════════════════════════════════════════════════════════════════════════
 
 import { SupabaseService } from '../services/supabase';
+import { getEntityCache } from '../services/entityCache';
 import { MetaWhatsAppService } from '../services/meta-whatsapp';
 import { CalendarService } from '../services/calendar';
 import { createLeadDeduplication } from '../services/leadDeduplicationService';
@@ -2347,6 +2348,7 @@ ${body.status_notes ? '📝 *Notas:* ' + body.status_notes : ''}
         .insert([safeBody])
         .select()
         .single();
+      await getEntityCache(supabase, env.SARA_CACHE).invalidate('properties');
       return corsResponse(JSON.stringify(data), 201);
     }
 
@@ -2373,10 +2375,8 @@ ${body.status_notes ? '📝 *Notas:* ' + body.status_notes : ''}
         .select()
         .single();
 
-      // Invalidate properties cache
-      if (env.SARA_CACHE) {
-        try { await env.SARA_CACHE.delete('properties:all'); } catch (_) {}
-      }
+      // Invalidate properties cache (scope + isolate + KV)
+      await getEntityCache(supabase, env.SARA_CACHE).invalidate('properties');
 
       return corsResponse(JSON.stringify(data || {}));
     }
@@ -2415,6 +2415,7 @@ ${body.status_notes ? '📝 *Notas:* ' + body.status_notes : ''}
           increase: newPrice - oldPrice
         });
       }
+      await getEntityCache(supabase, env.SARA_CACHE).invalidate('properties');
 
       return corsResponse(JSON.stringify({
         ok: true,
@@ -4,10 +4,12 @@
 // ═══════════════════════════════════════════════════════════════════════════
 
 import { SupabaseService } from '../services/supabase';
-import { buildReport, saveReport, getReport, listReports, updateReport, deleteReport, saveSnapshot, getSnapshots, exportReportToCSV } from '../services/reportBuilderService';
-import { generateForecast } from '../services/forecastingService';
+import { buildReport, saveReport, getReport, listReports, updateReport, deleteReport, getSnapshots, runSavedReport, validateReportConfig, streamReportRows, streamReportCSV } from '../services/reportBuilderService';
+import { generateForecast, getCachedForecast } from '../services/forecastingService';
+import { CacheService } from '../services/cacheService';
 import { generateAgentScorecard, generateTeamScorecard } from '../services/agentScorecardService';
 import { isAllowedCrmOrigin, parsePagination, validateRequired } from './cors';
+import { corsHeaders } from '../utils/middleware';
 import type { Env, CorsResponseFn, CheckApiAuthFn } from '../types/env';
 
 function checkAuth(request: Request, env: Env, corsResponse: CorsResponseFn, checkApiAuth: CheckApiAuthFn): Response | null {
@@ -24,7 +26,8 @@ export async function handleApiReportsProRoutes(
   env: Env,
   supabase: SupabaseService,
   corsResponse: CorsResponseFn,
-  checkApiAuth: CheckApiAuthFn
+  checkApiAuth: CheckApiAuthFn,
+  cache?: CacheService | null
 ): Promise<Response | null> {
 
   // ═══════════════════════════════════════════════════════════════
@@ -36,13 +39,25 @@ export async function handleApiReportsProRoutes(
     const authErr = checkAuth(request, env, corsResponse, checkApiAuth);
     if (authErr) return authErr;
     const body = await request.json() as any;
-    const err = validateRequired(body, ['entity']);
+    const err = validateRequired(body, ['entity']) || validateReportConfig(body);
     if (err) return corsResponse(JSON.stringify({ error: err }), 400);
+
+    // ?stream=1 → NDJSON por páginas (reportes con muchos grupos)
+    if (url.searchParams.get('stream') === '1') {
+      const encoder = new TextEncoder();
+      const ndjson = streamReportRows(supabase, body).pipeThrough(new TransformStream<Record<string, any>, Uint8Array>({
+        transform(row, controller) {
+          controller.enqueue(encoder.encode(JSON.stringify(row) + '\n'));
+        }
+      }));
+      return new Response(ndjson, { status: 200, headers: { ...corsHeaders(request), 'Content-Type': 'application/x-ndjson' } });
+    }
+
     const result = await buildReport(supabase, body);
     return corsResponse(JSON.stringify({ data: result }));
   }
 
-  // POST /api/reports/build-and-save — Execute + save snapshot
+  // POST /api/reports/build-and-save — Execute + save snapshot (reusa el último si nada cambió)
   if (url.pathname === '/api/reports/build-and-save' && request.method === 'POST') {
     const authErr = checkAuth(request, env, corsResponse, checkApiAuth);
     if (authErr) return authErr;
@@ -53,9 +68,8 @@ export async function handleApiReportsProRoutes(
     const report = await getReport(supabase, body.report_id);
     if (!report) return corsResponse(JSON.stringify({ error: 'Reporte no encontrado' }), 404);
 
-    const result = await buildReport(supabase, report.config);
-    await saveSnapshot(supabase, body.report_id, result);
-    return corsResponse(JSON.stringify({ data: result }));
+    const run = await runSavedReport(supabase, report, { force: body.force === true });
+    return corsResponse(JSON.stringify({ data: run.data, cached: run.cached, snapshot_id: run.snapshot_id }));
   }
 
   // ═══════════════════════════════════════════════════════════════
@@ -131,7 +145,10 @@ export async function handleApiReportsProRoutes(
   if (url.pathname === '/api/reports/forecast' && request.method === 'GET') {
     const authErr = checkAuth(request, env, corsResponse, checkApiAuth);
     if (authErr) return authErr;
-    const forecast = await generateForecast(supabase);
+    // Cacheado por día (lo precalcula el cron nocturno); ?fresh=1 recalcula
+    const forecast = cache && url.searchParams.get('fresh') !== '1'
+      ? await getCachedForecast(supabase, cache)
+      : await generateForecast(supabase, { cache });
     return corsResponse(JSON.stringify({ data: forecast }));
   }
 
@@ -169,19 +186,20 @@ export async function handleApiReportsProRoutes(
     if (authErr) return authErr;
     const body = await request.json() as any;
 
-    let result;
+    let config;
     if (body.report_id) {
       const report = await getReport(supabase, body.report_id);
       if (!report) return corsResponse(JSON.stringify({ error: 'Reporte no encontrado' }), 404);
-      result = await buildReport(supabase, report.config);
+      config = report.config;
     } else if (body.config) {
-      result = await buildReport(supabase, body.config);
+      config = body.config;
     } else {
       return corsResponse(JSON.stringify({ error: 'Se requiere report_id o config' }), 400);
     }
+    const invalid = validateReportConfig(config);
+    if (invalid) return corsResponse(JSON.stringify({ error: invalid }), 400);
 
-    const csv = exportReportToCSV(result);
-    return new Response(csv, {
+    return new Response(streamReportCSV(supabase, config), {
       status: 200,
       headers: {
         'Content-Type': 'text/csv; charset=utf-8',
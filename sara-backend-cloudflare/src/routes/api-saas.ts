@@ -9,6 +9,7 @@ import { getOnboardingStatus, completeWhatsAppSetup, completeTeamInvites, comple
 import { getUsage, getUsageSummary, checkLimit } from '../services/usageTrackingService';
 import { createInvitation, getInvitationByToken, listInvitations, acceptInvitation, revokeInvitation, resendInvitation } from '../services/invitationService';
 import { hashPassword, authenticateRequest, getJWTSecret, createJWT, createRefreshToken } from '../middleware/auth';
+import { invalidateTenant } from '../middleware/tenant';
 import { isAllowedCrmOrigin, validateRequired } from './cors';
 import type { Env, CorsResponseFn, CheckApiAuthFn } from '../types/env';
 
@@ -387,6 +388,7 @@ export async function handleApiSaasRoutes(
       .select()
       .single();
     if (error) return corsResponse(JSON.stringify({ error: error.message }), 500);
+    invalidateTenant(supabase.getTenantId());
     return corsResponse(JSON.stringify({ data: tenant }));
   }
 
@@ -512,6 +514,7 @@ export async function handleApiSaasRoutes(
       .single();
 
     if (error) return corsResponse(JSON.stringify({ error: error.message }), 500);
+    invalidateTenant(tenantId);
     return corsResponse(JSON.stringify({
       data: updated,
       fields_updated: Object.keys(updates),
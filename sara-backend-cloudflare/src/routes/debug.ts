@@ -0,0 +1,240 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// DEBUG ROUTES - E2E de resiliencia y load test (antes inline en index.ts)
+// Igual que routes/test.ts: solo se empaqueta en builds con __DEBUG_ROUTES__.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { SupabaseService } from '../services/supabase';
+import { MetaWhatsAppService } from '../services/meta-whatsapp';
+import { ClaudeService } from '../services/claude';
+import { AIConversationService } from '../services/aiConversationService';
+import { createMetaWithTracking } from '../utils/metaTracking';
+import { enviarMensajeTeamMember } from '../utils/teamMessaging';
+import { processRetryQueue, enqueueFailedMessage } from '../services/retryQueueService';
+import { logErrorToDB } from '../crons/healthCheck';
+import type { Env, CorsResponseFn } from '../types/env';
+
+export async function handleDebugRoutes(
+  url: URL,
+  request: Request,
+  env: Env,
+  supabase: SupabaseService,
+  corsResponse: CorsResponseFn
+): Promise<Response | null> {
+  if (url.pathname === '/test-resilience-e2e') {
+    return handleResilienceE2E(env, supabase, corsResponse);
+  }
+  // El límite de 5 req/min aplica a cualquier método; solo POST ejecuta
+  if (url.pathname === '/test-load-test' && request.method === 'POST') {
+    return handleLoadTest(url, env, supabase, corsResponse);
+  }
+  return null;
+}
+
+// ═══════════════════════════════════════════════════════════════
+// E2E TEST: Resilience Features
+// ═══════════════════════════════════════════════════════════════
+async function handleResilienceE2E(env: Env, supabase: SupabaseService, corsResponse: CorsResponseFn): Promise<Response | null> {
+  const tests: Array<{ name: string; pass: boolean; detail: string }> = [];
+
+  // ── TEST 1: retry_queue table exists ──
+  try {
+    const { data: rqData, error: rqErr } = await supabase.client.from('retry_queue').select('id', { count: 'exact', head: true });
+    tests.push({ name: 'retry_queue table exists', pass: !rqErr, detail: rqErr ? rqErr.message : 'OK' });
+  } catch (e: any) { tests.push({ name: 'retry_queue table exists', pass: false, detail: e.message }); }
+
+  // ── TEST 2: enqueueFailedMessage inserts retryable error ──
+  try {
+    await enqueueFailedMessage(supabase, '5210000099999', 'text', { body: 'E2E test message' }, 'e2e-test', 'Meta API error 500: Internal Server Error');
+    const { data: inserted } = await supabase.client.from('retry_queue').select('*').eq('recipient_phone', '5210000099999').eq('context', 'e2e-test').order('created_at', { ascending: false }).limit(1);
+    const ok = inserted && inserted.length > 0 && inserted[0].status === 'pending';
+    tests.push({ name: 'enqueueFailedMessage inserts pending entry', pass: !!ok, detail: ok ? `id=${inserted![0].id}` : 'No row found' });
+  } catch (e: any) { tests.push({ name: 'enqueueFailedMessage inserts pending entry', pass: false, detail: e.message }); }
+
+  // ── TEST 3: enqueueFailedMessage skips non-retryable (400) ──
+  try {
+    const { count: before } = await supabase.client.from('retry_queue').select('id', { count: 'exact', head: true }).eq('recipient_phone', '5210000088888');
+    await enqueueFailedMessage(supabase, '5210000088888', 'text', { body: 'skip' }, 'e2e-skip', 'Meta API error 400: Bad Request');
+    const { count: after } = await supabase.client.from('retry_queue').select('id', { count: 'exact', head: true }).eq('recipient_phone', '5210000088888');
+    const ok = (after || 0) === (before || 0);
+    tests.push({ name: 'enqueueFailedMessage skips 400 error', pass: ok, detail: ok ? 'Correctly skipped' : `before=${before} after=${after}` });
+  } catch (e: any) { tests.push({ name: 'enqueueFailedMessage skips 400 error', pass: false, detail: e.message }); }
+
+  // Create meta instance for tests that need it
+  const testMeta = await createMetaWithTracking(env, supabase);
+
+  // ── TEST 4: processRetryQueue processes & delivers test entry ──
+  try {
+    const rqResult = await processRetryQueue(supabase, testMeta, env.DEV_PHONE || '5610016226');
+    tests.push({ name: 'processRetryQueue runs without error', pass: true, detail: `processed=${rqResult.processed} delivered=${rqResult.delivered} failed=${rqResult.failedPermanent}` });
+  } catch (e: any) { tests.push({ name: 'processRetryQueue runs without error', pass: false, detail: e.message }); }
+
+  // ── TEST 5: processRetryQueue increments attempts on failure ──
+  try {
+    const { data: updated } = await supabase.client.from('retry_queue').select('*').eq('recipient_phone', '5210000099999').eq('context', 'e2e-test').order('created_at', { ascending: false }).limit(1);
+    const entry = updated?.[0];
+    const ok = entry && entry.attempts >= 1;
+    tests.push({ name: 'retry entry attempts incremented after processing', pass: !!ok, detail: entry ? `attempts=${entry.attempts} status=${entry.status}` : 'No entry found' });
+  } catch (e: any) { tests.push({ name: 'retry entry attempts incremented after processing', pass: false, detail: e.message }); }
+
+  // ── TEST 6: KV dedup write ──
+  try {
+    const testKey = 'wamsg:e2e_test_msg_' + Date.now();
+    await env.SARA_CACHE.put(testKey, '1', { expirationTtl: 60 });
+    const val = await env.SARA_CACHE.get(testKey);
+    tests.push({ name: 'KV dedup write + read works', pass: val === '1', detail: val === '1' ? 'OK' : `got: ${val}` });
+  } catch (e: any) { tests.push({ name: 'KV dedup write + read works', pass: false, detail: e.message }); }
+
+  // ── TEST 7: KV dedup blocks duplicate messageId ──
+  try {
+    const dupKey = 'wamsg:e2e_dup_test_' + Date.now();
+    await env.SARA_CACHE.put(dupKey, '1', { expirationTtl: 60 });
+    const hit = await env.SARA_CACHE.get(dupKey);
+    tests.push({ name: 'KV dedup detects duplicate messageId', pass: hit === '1', detail: hit === '1' ? 'Duplicate correctly detected' : `got: ${hit}` });
+  } catch (e: any) { tests.push({ name: 'KV dedup detects duplicate messageId', pass: false, detail: e.message }); }
+
+  // ── TEST 8: KV dedup returns null for new messageId ──
+  try {
+    const newKey = 'wamsg:e2e_new_test_' + Date.now() + '_unique';
+    const miss = await env.SARA_CACHE.get(newKey);
+    tests.push({ name: 'KV dedup returns null for new messageId', pass: miss === null, detail: miss === null ? 'Correctly null' : `got: ${miss}` });
+  } catch (e: any) { tests.push({ name: 'KV dedup returns null for new messageId', pass: false, detail: e.message }); }
+
+  // ── TEST 9: AI fallback code path exists (import check) ──
+  try {
+    const hasLogErrorToDB = typeof logErrorToDB === 'function';
+    const hasEnviarMensaje = typeof enviarMensajeTeamMember === 'function';
+    tests.push({ name: 'AI fallback dependencies available (logErrorToDB + enviarMensajeTeamMember)', pass: hasLogErrorToDB && hasEnviarMensaje, detail: `logErrorToDB=${hasLogErrorToDB} enviarMensajeTeamMember=${hasEnviarMensaje}` });
+  } catch (e: any) { tests.push({ name: 'AI fallback dependencies available', pass: false, detail: e.message }); }
+
+  // ── TEST 10: AI fallback - logErrorToDB writes to error_logs ──
+  try {
+    await logErrorToDB(supabase, 'e2e_test_error', 'Resilience E2E test - safe to ignore', { severity: 'warning' as any, source: 'e2e-test-resilience', context: { test: true } });
+    const { data: errLog } = await supabase.client.from('error_logs').select('id').eq('error_type', 'e2e_test_error').eq('source', 'e2e-test-resilience').order('created_at', { ascending: false }).limit(1);
+    const ok = errLog && errLog.length > 0;
+    tests.push({ name: 'logErrorToDB writes to error_logs table', pass: !!ok, detail: ok ? `id=${errLog![0].id}` : 'No row found' });
+    // Cleanup
+    if (ok) await supabase.client.from('error_logs').delete().eq('id', errLog![0].id);
+  } catch (e: any) { tests.push({ name: 'logErrorToDB writes to error_logs table', pass: false, detail: e.message }); }
+
+  // ── TEST 11: failedMessageCallback is wired in MetaWhatsAppService ──
+  try {
+    const hasCallback = typeof (testMeta as any).failedMessageCallback === 'function';
+    tests.push({ name: 'MetaWhatsAppService has failedMessageCallback wired', pass: hasCallback, detail: hasCallback ? 'Callback is set' : 'Callback is null/undefined' });
+  } catch (e: any) { tests.push({ name: 'MetaWhatsAppService has failedMessageCallback wired', pass: false, detail: e.message }); }
+
+  // ── TEST 12: trackingCallback is also wired (sanity) ──
+  try {
+    const hasTracking = typeof (testMeta as any).trackingCallback === 'function';
+    tests.push({ name: 'MetaWhatsAppService has trackingCallback wired (sanity)', pass: hasTracking, detail: hasTracking ? 'OK' : 'Missing' });
+  } catch (e: any) { tests.push({ name: 'MetaWhatsAppService has trackingCallback wired', pass: false, detail: e.message }); }
+
+  // ── CLEANUP: Remove test entries from retry_queue ──
+  try {
+    await supabase.client.from('retry_queue').delete().eq('recipient_phone', '5210000099999');
+    await supabase.client.from('retry_queue').delete().eq('recipient_phone', '5210000088888');
+  } catch (_) {}
+
+  const passed = tests.filter(t => t.pass).length;
+  const failed = tests.filter(t => !t.pass).length;
+
+  return corsResponse(JSON.stringify({
+    summary: `${passed}/${tests.length} passed, ${failed} failed`,
+    timestamp: new Date().toISOString(),
+    tests
+  }, null, 2));
+  return null;
+}
+
+// ═══════════════════════════════════════════════════════════════
+// LOAD TEST: Simula N leads concurrentes (NO envía WhatsApp real)
+// POST /test-load-test?concurrent=20&api_key=XXX
+// ═══════════════════════════════════════════════════════════════
+async function handleLoadTest(url: URL, env: Env, supabase: SupabaseService, corsResponse: CorsResponseFn): Promise<Response | null> {
+  const concurrent = parseInt(url.searchParams.get('concurrent') || '10');
+  const maxConcurrent = Math.min(concurrent, 50); // Cap at 50
+
+  const claude = new ClaudeService(env.ANTHROPIC_API_KEY);
+  const loadTestMeta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+  const aiService = new AIConversationService(supabase, null, loadTestMeta, null, claude, env);
+
+  // Obtener propiedades para contexto
+  const { data: props } = await supabase.client.from('properties').select('*').limit(50);
+  const properties = props || [];
+
+  const desarrollos = ['Monte Verde', 'Los Encinos', 'Distrito Falco', 'Andes', 'Miravalle'];
+  const mensajes = [
+    'hola busco casa de 3 recamaras',
+    'que tienen en {desarrollo}',
+    'quiero agendar cita el sabado a las 11'
+  ];
+
+  const results: Array<{ leadId: number; step: string; success: boolean; time_ms: number; error?: string }> = [];
+  const startTime = Date.now();
+
+  // Simular leads concurrentes
+  const promises = Array.from({ length: maxConcurrent }, async (_, i) => {
+    const leadNum = i + 1;
+    const desarrollo = desarrollos[i % desarrollos.length];
+
+    for (const msgTemplate of mensajes) {
+      const msg = msgTemplate.replace('{desarrollo}', desarrollo);
+      const stepStart = Date.now();
+
+      try {
+        const fakeLead = {
+          id: `load-test-${leadNum}`,
+          name: `Lead Test ${leadNum}`,
+          phone: `521000000${String(leadNum).padStart(4, '0')}`,
+          status: 'new',
+          score: 0,
+          notes: {},
+          conversation_history: [],
+          property_interest: null,
+          assigned_to: null
+        };
+
+        const analysis = await aiService.analyzeWithAI(msg, fakeLead, properties);
+        const elapsed = Date.now() - stepStart;
+
+        results.push({
+          leadId: leadNum,
+          step: msg.substring(0, 40),
+          success: !!analysis?.response,
+          time_ms: elapsed
+        });
+      } catch (err: any) {
+        results.push({
+          leadId: leadNum,
+          step: msg.substring(0, 40),
+          success: false,
+          time_ms: Date.now() - stepStart,
+          error: err.message?.substring(0, 100)
+        });
+      }
+    }
+  });
+
+  await Promise.all(promises);
+
+  const totalTime = Date.now() - startTime;
+  const successResults = results.filter(r => r.success);
+  const failedResults = results.filter(r => !r.success);
+  const times = successResults.map(r => r.time_ms);
+  const avgTime = times.length > 0 ? Math.round(times.reduce((a, b) => a + b, 0) / times.length) : 0;
+  const maxTime = times.length > 0 ? Math.max(...times) : 0;
+  const minTime = times.length > 0 ? Math.min(...times) : 0;
+
+  return corsResponse(JSON.stringify({
+    ok: true,
+    concurrent: maxConcurrent,
+    total_requests: results.length,
+    success: successResults.length,
+    failed: failedResults.length,
+    total_time_ms: totalTime,
+    avg_response_ms: avgTime,
+    min_response_ms: minTime,
+    max_response_ms: maxTime,
+    errors: failedResults.map(r => ({ lead: r.leadId, step: r.step, error: r.error }))
+  }));
+  return null;
+}
@@ -0,0 +1,3078 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// OPS ROUTES - Health, CRON manuales (/run-*), backups, encuestas, asesor
+// Separadas de routes/test.ts: estas sí van en el bundle de producción.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { SupabaseService } from '../services/supabase';
+import { MetaWhatsAppService } from '../services/meta-whatsapp';
+import { CacheService } from '../services/cacheService';
+import { getEntityCache } from '../services/entityCache';
+import { ClaudeService } from '../services/claude';
+import { CalendarService } from '../services/calendar';
+import { CEOCommandsService } from '../services/ceoCommandsService';
+import { VendorCommandsService } from '../services/vendorCommandsService';
+import { AIConversationService } from '../services/aiConversationService';
+import { isPendingExpired, verificarPendingParaLlamar, CALL_CONFIG } from '../utils/teamMessaging';
+
+// CRON imports
+import { iniciarFlujosPostVisita } from '../crons/reports';
+
+import { enviarBriefingMatutino } from '../crons/briefings';
+
+import { enviarAlertasProactivasCEO } from '../crons/alerts';
+
+import { actualizarLeadScores } from '../crons/leadScoring';
+
+import {
+  followUpPostVisita,
+  nurturingEducativo,
+  seguimientoPostEntrega,
+  encuestaSatisfaccionCasa,
+  checkInMantenimiento,
+  solicitarReferidos,
+  enviarEncuestaNPS,
+} from '../crons/nurturing';
+
+import { verificarVideosPendientes, videoBienvenidaLeadNuevo, videoFelicitacionPostVenta } from '../crons/videos';
+
+import { runHealthCheck, trackError, enviarAlertaSistema, healthMonitorCron } from '../crons/healthCheck';
+import { backupSemanalR2 } from '../crons/dashboard';
+import { createIncrementalBackup, INCREMENTAL_BACKUP_TABLES } from '../services/incrementalBackupService';
+import { aplicarPreciosProgramados } from '../crons/reports';
+
+import type { Env, CorsResponseFn, CheckApiAuthFn } from '../types/env';
+
+export async function handleOpsRoutes(
+  url: URL,
+  request: Request,
+  env: Env,
+  supabase: SupabaseService,
+  corsResponse: CorsResponseFn,
+  checkApiAuth: CheckApiAuthFn,
+  cache: CacheService | null
+): Promise<Response | null> {
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // RETELL CALL STATUS - Ver status de llamadas recientes
+    // USO: /retell-status?call_id=XXX  o  /retell-status (lista recientes)
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/retell-status" && request.method === "GET") {
+      try {
+        const authError = checkApiAuth(request, env);
+        if (authError) return authError;
+
+        if (!env.RETELL_API_KEY) {
+          return corsResponse(JSON.stringify({ error: 'RETELL_API_KEY no configurado' }));
+        }
+
+        const { createRetellService } = await import('../services/retellService');
+        const retell = createRetellService(env.RETELL_API_KEY, env.RETELL_AGENT_ID || '', env.RETELL_PHONE_NUMBER || '');
+
+        const callId = url.searchParams.get('call_id');
+
+        if (callId) {
+          // Detalle de una llamada específica
+          const details = await retell.getCallDetails(callId);
+          return corsResponse(JSON.stringify({ ok: !!details, call: details }));
+        } else {
+          // Lista de llamadas recientes
+          const calls = await retell.listRecentCalls(10);
+          const summary = calls.map((c: any) => ({
+            call_id: c.call_id,
+            status: c.call_status || c.status,
+            to: c.to_number,
+            from: c.from_number,
+            duration_sec: c.duration_ms ? Math.round(c.duration_ms / 1000) : null,
+            started: c.start_timestamp ? new Date(c.start_timestamp).toISOString() : null,
+            ended: c.end_timestamp ? new Date(c.end_timestamp).toISOString() : null,
+            disconnect_reason: c.disconnection_reason || c.disconnect_reason,
+          }));
+          return corsResponse(JSON.stringify({ ok: true, count: calls.length, calls: summary }));
+        }
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ ok: false, error: e.message }));
+      }
+    }
+
+    // Leer debug logs del webhook Retell desde KV
+    if (url.pathname === '/retell-debug-logs' && request.method === 'GET') {
+      try {
+        const authError = checkApiAuth(request, env);
+        if (authError) return authError;
+        const keys = await env.SARA_CACHE.list({ prefix: 'retell_' });
+        const logs: any[] = [];
+        for (const key of keys.keys) {
+          const val = await env.SARA_CACHE.get(key.name, 'json');
+          logs.push({ key: key.name, data: val });
+        }
+        return corsResponse(JSON.stringify({ count: logs.length, logs }, null, 2));
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ error: e.message }), 500);
+      }
+    }
+
+    // Verificar configuración del agente Retell (webhook URL)
+    if (url.pathname === '/retell-agent-config' && request.method === 'GET') {
+      try {
+        const authError = checkApiAuth(request, env);
+        if (authError) return authError;
+        const agentId = env.RETELL_AGENT_ID || 'agent_3299a30fa8364c88d298df056e';
+        const resp = await fetch(`https://api.retellai.com/get-agent/${agentId}`, {
+          headers: { 'Authorization': `Bearer ${env.RETELL_API_KEY}` }
+        });
+        const agentData = await resp.json() as any;
+        return corsResponse(JSON.stringify({
+          agent_id: agentId,
+          agent_name: agentData.agent_name,
+          webhook_url: agentData.webhook_url || 'NOT SET',
+          post_call_analysis: agentData.post_call_analysis_data ? 'CONFIGURED' : 'NOT SET',
+          voice_id: agentData.voice_id,
+          language: agentData.language,
+        }, null, 2));
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // 🔧 SET ONBOARDING - Marcar vendedor como onboarding completado
+    // USO: /set-onboarding?phone=5212224558475
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/set-onboarding" && request.method === "GET") {
+      const phone = url.searchParams.get('phone') || '5212224558475';
+      const phoneLimpio = phone.replace(/\D/g, '').slice(-10);
+
+      const { data: member } = await supabase.client
+        .from('team_members')
+        .select('id, name, notes')
+        .ilike('phone', `%${phoneLimpio}`)
+        .single();
+
+      if (!member) {
+        return corsResponse(JSON.stringify({ error: 'Team member no encontrado', phone: phoneLimpio }), 404);
+      }
+
+      const notas = typeof member.notes === 'object' ? (member.notes || {}) : {};
+      const notasActualizadas = {
+        ...notas,
+        onboarding_completed: true,
+        onboarding_date: new Date().toISOString()
+      };
+
+      await supabase.client.from('team_members').update({ notes: notasActualizadas }).eq('id', member.id);
+
+      return corsResponse(JSON.stringify({
+        ok: true,
+        member: member.name,
+        onboarding_completed: true
+      }));
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // 🧹 LIMPIAR-ALERTAS - Limpia alertas pendientes de leads para un vendedor
+    // USO: /limpiar-alertas?phone=5212224558475&api_key=XXX
+    // Esto es útil cuando hay múltiples leads con alerta_vendedor_id del mismo vendedor
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/limpiar-alertas" && request.method === "GET") {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+
+      const phone = url.searchParams.get('phone') || '5212224558475';
+      const phoneLimpio = phone.replace(/\D/g, '');
+
+      try {
+        // Buscar vendedor
+        const { data: vendedor } = await supabase.client
+          .from('team_members')
+          .select('id, name')
+          .or(`phone.eq.${phoneLimpio},phone.like.%${phoneLimpio.slice(-10)}`)
+          .maybeSingle();
+
+        if (!vendedor) {
+          return corsResponse(JSON.stringify({
+            error: 'Vendedor no encontrado',
+            phone: phoneLimpio
+          }), 404);
+        }
+
+        // Buscar leads con alertas pendientes de este vendedor
+        const { data: leadsConAlerta } = await supabase.client
+          .from('leads')
+          .select('id, name, phone, notes')
+          .eq('notes->>alerta_vendedor_id', vendedor.id)
+          .not('notes->>sugerencia_pendiente', 'is', null);
+
+        if (!leadsConAlerta || leadsConAlerta.length === 0) {
+          return corsResponse(JSON.stringify({
+            ok: true,
+            message: 'No hay alertas pendientes para limpiar',
+            vendedor: vendedor.name,
+            leadsLimpiados: 0
+          }));
+        }
+
+        // Limpiar alertas de todos los leads
+        let limpiados = 0;
+        for (const lead of leadsConAlerta) {
+          const notas = lead.notes || {};
+          delete notas.sugerencia_pendiente;
+          delete notas.alerta_vendedor_id;
+
+          await supabase.client.from('leads')
+            .update({ notes: notas })
+            .eq('id', lead.id);
+
+          limpiados++;
+        }
+
+        console.log(`🧹 Limpiadas ${limpiados} alertas pendientes del vendedor ${vendedor.name}`);
+
+        return corsResponse(JSON.stringify({
+          ok: true,
+          vendedor: vendedor.name,
+          leadsLimpiados: limpiados,
+          leads: leadsConAlerta.map(l => ({ id: l.id, name: l.name || 'Sin nombre', phone: l.phone }))
+        }));
+
+      } catch (e: any) {
+        console.error('❌ Error en limpiar-alertas:', e);
+        return corsResponse(JSON.stringify({ ok: false, error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // 🧹 LIMPIAR-PENDING-EXPIRADOS - Limpia pending messages expirados de team_members
+    // USO: /limpiar-pending-expirados?api_key=XXX
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/limpiar-pending-expirados" && request.method === "GET") {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+
+      try {
+        const { data: teamMembers } = await supabase.client
+          .from('team_members')
+          .select('id, name, notes')
+          .eq('active', true);
+
+        const pendingKeys = [
+          { key: 'pending_briefing', type: 'briefing' },
+          { key: 'pending_recap', type: 'recap' },
+          { key: 'pending_reporte_diario', type: 'reporte_diario' },
+          { key: 'pending_reporte_semanal', type: 'resumen_semanal' },
+          { key: 'pending_resumen_semanal', type: 'resumen_semanal' },
+          { key: 'pending_mensaje', type: 'notificacion' },
+          { key: 'pending_test_7pm', type: 'notificacion' },
+          { key: 'pending_video_semanal', type: 'resumen_semanal' },
+        ];
+
+        let totalLimpiados = 0;
+        const detalles: any[] = [];
+
+        for (const tm of teamMembers || []) {
+          const notas = typeof tm.notes === 'string'
+            ? JSON.parse(tm.notes || '{}')
+            : (tm.notes || {});
+
+          let modificado = false;
+          const limpiados: string[] = [];
+
+          for (const { key, type } of pendingKeys) {
+            const pending = notas[key];
+            if (pending?.mensaje_completo || pending?.sent_at) {
+              // Verificar si expiró usando la función isPendingExpired
+              if (isPendingExpired(pending, type)) {
+                delete notas[key];
+                modificado = true;
+                limpiados.push(key);
+                totalLimpiados++;
+              }
+            }
+          }
+
+          if (modificado) {
+            await supabase.client
+              .from('team_members')
+              .update({ notes: notas })
+              .eq('id', tm.id);
+
+            detalles.push({
+              nombre: tm.name,
+              limpiados
+            });
+          }
+        }
+
+        return corsResponse(JSON.stringify({
+          ok: true,
+          total_limpiados: totalLimpiados,
+          team_members_afectados: detalles.length,
+          detalles
+        }, null, 2));
+
+      } catch (e: any) {
+        console.error('❌ Error en limpiar-pending-expirados:', e);
+        return corsResponse(JSON.stringify({ ok: false, error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // 🧹 DELETE-ALL-LEADS - Borra TODOS los leads y datos relacionados
+    // USO: /delete-all-leads?api_key=XXX&confirm=yes
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/delete-all-leads" && request.method === "GET") {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+
+      const confirm = url.searchParams.get('confirm');
+      if (confirm !== 'yes') {
+        return corsResponse(JSON.stringify({ ok: false, error: 'Agrega ?confirm=yes para confirmar' }), 400);
+      }
+
+      try {
+        const deletedFrom: Record<string, number> = {};
+        const childTables = ['surveys', 'appointments', 'mortgage_applications', 'messages', 'reservations', 'offers', 'conversation_history', 'follow_ups', 'activities', 'lead_activities', 'event_registrations', 'pending_videos', 'call_logs'];
+
+        for (const table of childTables) {
+          try {
+            const { data } = await supabase.client.from(table).delete().not('id', 'is', null).select('id');
+            if (data && data.length > 0) deletedFrom[table] = data.length;
+          } catch {}
+        }
+
+        // Delete all leads
+        const { data: deletedLeads } = await supabase.client.from('leads').delete().not('id', 'is', null).select('id, name, phone');
+        deletedFrom['leads'] = deletedLeads?.length || 0;
+
+        return corsResponse(JSON.stringify({
+          ok: true,
+          message: 'Todos los leads y datos relacionados han sido eliminados',
+          deleted_from: deletedFrom,
+          leads_deleted: deletedLeads?.map(l => ({ name: l.name, phone: l.phone })) || []
+        }, null, 2));
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ ok: false, error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // 🧹 CLEANUP-TEST-LEADS - Elimina lead + todas las dependencias (surveys incluidas)
+    // USO: /cleanup-test-leads?phone=5610016226&api_key=XXX
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/cleanup-test-leads" && request.method === "GET") {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+
+      try {
+        const phone = url.searchParams.get('phone');
+        if (!phone) {
+          return corsResponse(JSON.stringify({ ok: false, error: 'Falta parámetro phone' }), 400);
+        }
+
+        const phoneSuffix = phone.replace(/\D/g, '').slice(-10);
+        const deletedFrom: Record<string, number> = {};
+
+        // 1. Buscar leads que coincidan
+        const { data: allLeads } = await supabase.client
+          .from('leads')
+          .select('id, phone, name')
+          .not('phone', 'is', null);
+        const matchingLeads = (allLeads || []).filter(l =>
+          l.phone?.replace(/\D/g, '').slice(-10) === phoneSuffix
+        );
+
+        if (matchingLeads.length === 0) {
+          return corsResponse(JSON.stringify({ ok: true, message: 'No se encontraron leads con ese teléfono', phone }));
+        }
+
+        for (const lead of matchingLeads) {
+          // Delete from all related tables
+          const tables = ['surveys', 'appointments', 'mortgage_applications', 'messages', 'reservations', 'offers', 'conversation_history', 'lead_activities', 'event_registrations', 'pending_videos', 'call_logs'];
+          for (const table of tables) {
+            try {
+              const { data } = await supabase.client.from(table).delete().eq('lead_id', lead.id).select('id');
+              if (data && data.length > 0) deletedFrom[table] = (deletedFrom[table] || 0) + data.length;
+            } catch {}
+          }
+          // Also delete surveys by phone (they might not have lead_id)
+          try {
+            const { data } = await supabase.client.from('surveys').delete().like('lead_phone', `%${phoneSuffix}`).select('id');
+            if (data && data.length > 0) deletedFrom['surveys_by_phone'] = (deletedFrom['surveys_by_phone'] || 0) + data.length;
+          } catch {}
+          // Optional tables
+          try { await supabase.client.from('follow_ups').delete().eq('lead_id', lead.id); } catch {}
+          try { await supabase.client.from('activities').delete().eq('lead_id', lead.id); } catch {}
+          // Delete the lead itself
+          const { error: leadDeleteError } = await supabase.client.from('leads').delete().eq('id', lead.id);
+          if (leadDeleteError) {
+            console.error('❌ Error borrando lead:', lead.id, leadDeleteError.message, leadDeleteError.details, leadDeleteError.hint);
+            deletedFrom['lead_delete_error'] = leadDeleteError.message as any;
+          } else {
+            deletedFrom['leads'] = (deletedFrom['leads'] || 0) + 1;
+          }
+        }
+
+        return corsResponse(JSON.stringify({
+          ok: true,
+          phone,
+          leads_found: matchingLeads.length,
+          leads_deleted: matchingLeads.map(l => ({ id: l.id, name: l.name })),
+          deleted_from: deletedFrom
+        }, null, 2));
+
+      } catch (e: any) {
+        console.error('❌ Error en cleanup-test-leads:', e);
+        return corsResponse(JSON.stringify({ ok: false, error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // 📞 VERIFICAR-PENDING-LLAMADAS - Sistema híbrido: llama si pasaron 2h sin respuesta
+    // USO: /verificar-pending-llamadas?api_key=XXX
+    // NOTA: Se ejecuta automáticamente en CRON cada 30 minutos
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/verificar-pending-llamadas" && request.method === "GET") {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+
+      try {
+        // Verificar si Retell está configurado
+        if (!env.RETELL_API_KEY || !env.RETELL_AGENT_ID || !env.RETELL_PHONE_NUMBER) {
+          return corsResponse(JSON.stringify({
+            ok: false,
+            error: 'Retell no está configurado',
+            missing: {
+              RETELL_API_KEY: !env.RETELL_API_KEY,
+              RETELL_AGENT_ID: !env.RETELL_AGENT_ID,
+              RETELL_PHONE_NUMBER: !env.RETELL_PHONE_NUMBER
+            }
+          }, null, 2), 400);
+        }
+
+        const retellConfig = {
+          apiKey: env.RETELL_API_KEY,
+          agentId: env.RETELL_AGENT_ID,
+          phoneNumber: env.RETELL_PHONE_NUMBER
+        };
+
+        // Crear instancia de Meta para enviar mensajes
+        const metaService = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+
+        // Modo debug: mostrar estado actual sin ejecutar llamadas
+        const debugMode = url.searchParams.get('debug') === 'true';
+        const resetMode = url.searchParams.get('reset') === 'true';
+
+        if (debugMode || resetMode) {
+          // Obtener team members con pending messages
+          const { data: teamMembers } = await supabase.client
+            .from('team_members')
+            .select('*')
+            .eq('active', true)
+            .in('role', ['vendedor', 'admin']);
+
+          const pendingDetails: any[] = [];
+          const tiposConLlamada = ['briefing', 'reporte_diario', 'alerta_lead', 'recordatorio_cita'];
+          const pendingKeyMap: Record<string, string> = {
+            'briefing': 'pending_briefing',
+            'reporte_diario': 'pending_reporte_diario',
+            'alerta_lead': 'pending_alerta_lead',
+            'recordatorio_cita': 'pending_recordatorio_cita',
+          };
+
+          for (const tm of teamMembers || []) {
+            const notas = typeof tm.notes === 'string' ? JSON.parse(tm.notes || '{}') : (tm.notes || {});
+
+            for (const tipo of tiposConLlamada) {
+              const pendingKey = pendingKeyMap[tipo];
+              const pending = notas[pendingKey];
+
+              if (pending?.mensaje_completo) {
+                const sentAt = new Date(pending.sent_at).getTime();
+                const tiempoEspera = Date.now() - sentAt;
+                const horasEspera = Math.round(tiempoEspera / (1000 * 60 * 60) * 10) / 10;
+
+                pendingDetails.push({
+                  nombre: tm.name,
+                  telefono: tm.phone,
+                  tipo,
+                  enviado_hace: `${horasEspera}h`,
+                  llamada_intentada: pending.llamada_intentada || false,
+                  ultimo_error: pending.ultimo_error_llamada,
+                });
+
+                // Si es modo reset, limpiar el flag
+                if (resetMode && pending.llamada_intentada) {
+                  delete notas[pendingKey].llamada_intentada;
+                  delete notas[pendingKey].ultimo_error_llamada;
+                  await supabase.client.from('team_members').update({ notes: notas }).eq('id', tm.id);
+                }
+              }
+            }
+          }
+
+          return corsResponse(JSON.stringify({
+            ok: true,
+            mode: resetMode ? 'reset' : 'debug',
+            pending_con_llamada: pendingDetails,
+            retell_config: {
+              from_number: env.RETELL_PHONE_NUMBER,
+              agent_id: env.RETELL_AGENT_ID ? '✅ Configurado' : '❌ Falta',
+              api_key: env.RETELL_API_KEY ? '✅ Configurado' : '❌ Falta',
+            }
+          }, null, 2));
+        }
+
+        console.log('📞 Ejecutando verificación manual de pending para llamar...');
+        const result = await verificarPendingParaLlamar(supabase, metaService, retellConfig);
+
+        return corsResponse(JSON.stringify({
+          ok: true,
+          llamadas_realizadas: result.llamadas,
+          errores: result.errores,
+          detalles_errores: result.detalles || [],
+          config: {
+            horasEspera: CALL_CONFIG.esperaAntesLlamar,
+            maxLlamadasDia: CALL_CONFIG.maxLlamadasDia,
+            horasPermitidas: `${CALL_CONFIG.horasPermitidas.inicio}:00 - ${CALL_CONFIG.horasPermitidas.fin}:00 (México)`
+          }
+        }, null, 2));
+
+      } catch (e: any) {
+        console.error('❌ Error en verificar-pending-llamadas:', e);
+        return corsResponse(JSON.stringify({ ok: false, error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // 🚨 EMERGENCY STOP - Detener TODOS los broadcasts inmediatamente
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === "/api/emergency-stop" && request.method === "POST") {
+      console.log('🚨 EMERGENCY STOP ACTIVADO');
+
+      // 1. Desactivar broadcasts en system_config
+      await supabase.client
+        .from('system_config')
+        .upsert({ key: 'broadcasts_enabled', value: 'false', updated_at: new Date().toISOString() });
+
+      // 2. Cancelar TODOS los jobs pendientes en la cola
+      const { data: cancelled } = await supabase.client
+        .from('broadcast_jobs')
+        .update({ status: 'cancelled', error_message: 'EMERGENCY STOP activado' })
+        .in('status', ['pending', 'processing'])
+        .select('id');
+
+      // 3. Cancelar follow-ups pendientes
+      const { data: followupsCancelled } = await supabase.client
+        .from('scheduled_followups')
+        .update({ cancelled: true, cancel_reason: 'EMERGENCY STOP' })
+        .eq('sent', false)
+        .eq('cancelled', false)
+        .select('id');
+
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await enviarAlertaSistema(meta,
+        `🚨 EMERGENCY STOP ACTIVADO\n\n✅ Broadcasts deshabilitados\n✅ ${cancelled?.length || 0} jobs cancelados\n✅ ${followupsCancelled?.length || 0} follow-ups cancelados\n\nPara reactivar: POST /api/broadcasts-enable`,
+        env, 'emergency_stop'
+      );
+
+      return corsResponse(JSON.stringify({
+        success: true,
+        message: 'EMERGENCY STOP activado',
+        cancelled_jobs: cancelled?.length || 0,
+        cancelled_followups: followupsCancelled?.length || 0
+      }));
+    }
+
+    // Reactivar broadcasts después de emergency stop
+    if (url.pathname === "/api/broadcasts-enable" && request.method === "POST") {
+      await supabase.client
+        .from('system_config')
+        .upsert({ key: 'broadcasts_enabled', value: 'true', updated_at: new Date().toISOString() });
+
+      return corsResponse(JSON.stringify({ success: true, message: 'Broadcasts reactivados' }));
+    }
+
+    // Ver estado del sistema
+    if (url.pathname === "/api/system-status" && request.method === "GET") {
+      const { data: config } = await supabase.client
+        .from('system_config')
+        .select('*')
+        .eq('key', 'broadcasts_enabled')
+        .single();
+
+      const { data: pendingJobs } = await supabase.client
+        .from('broadcast_jobs')
+        .select('id, status')
+        .in('status', ['pending', 'processing']);
+
+      const { data: pendingFollowups } = await supabase.client
+        .from('scheduled_followups')
+        .select('id')
+        .eq('sent', false)
+        .eq('cancelled', false);
+
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      const rateLimitStats = meta.getRateLimitStats();
+
+      return corsResponse(JSON.stringify({
+        broadcasts_enabled: config?.value !== 'false',
+        pending_broadcast_jobs: pendingJobs?.length || 0,
+        pending_followups: pendingFollowups?.length || 0,
+        rate_limit_stats: rateLimitStats
+      }));
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // CANCEL APPOINTMENT BY PHONE - Cancelar cita de un lead por teléfono
+    // ═══════════════════════════════════════════════════════════
+    if (url.pathname === '/api/cancel-appointment' && request.method === 'POST') {
+      try {
+        const body = await request.json() as { telefono: string };
+        const telefono = body.telefono;
+        if (!telefono) {
+          return corsResponse(JSON.stringify({ error: 'telefono requerido' }), 400);
+        }
+
+        const supabase = new SupabaseService(env.SUPABASE_URL, env.SUPABASE_ANON_KEY);
+        const phoneClean = telefono.replace(/\D/g, '').slice(-10);
+
+        // Buscar lead
+        const { data: leads } = await supabase.client.from('leads').select('*').ilike('phone', `%${phoneClean}%`);
+        if (!leads || leads.length === 0) {
+          return corsResponse(JSON.stringify({ error: 'Lead no encontrado' }), 404);
+        }
+
+        const lead = leads[0];
+        console.log(`🗑️ Cancelando citas para lead ${lead.id} (${lead.name})`);
+
+        // Buscar y cancelar citas
+        const { data: appointments } = await supabase.client.from('appointments').select('*').eq('lead_id', lead.id).neq('status', 'cancelled');
+
+        if (!appointments || appointments.length === 0) {
+          return corsResponse(JSON.stringify({ message: 'No hay citas activas para este lead', lead_id: lead.id }));
+        }
+
+        let citasCanceladas = 0;
+        for (const apt of appointments) {
+          await supabase.client.from('appointments').update({
+            status: 'cancelled',
+            cancellation_reason: 'Cancelado para prueba E2E',
+            cancelled_by: 'admin'
+          }).eq('id', apt.id);
+          citasCanceladas++;
+          console.log(`✅ Cita ${apt.id} cancelada`);
+        }
+
+        // Actualizar status del lead a contacted
+        await supabase.client.from('leads').update({
+          status: 'contacted',
+          property_interest: null
+        }).eq('id', lead.id);
+
+        return corsResponse(JSON.stringify({
+          success: true,
+          lead_id: lead.id,
+          lead_name: lead.name,
+          citas_canceladas: citasCanceladas
+        }));
+      } catch (error: any) {
+        return corsResponse(JSON.stringify({ error: error.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // TEST: Listar leads y actualizar status
+    // ═══════════════════════════════════════════════════════════
+    if (url.pathname === '/list-leads') {
+      const { data: leads } = await supabase.client
+        .from('leads')
+        .select('id, name, phone, status, property_interest')
+        .limit(20);
+      return corsResponse(JSON.stringify(leads, null, 2));
+    }
+
+    if (url.pathname.startsWith('/set-sold/')) {
+      const leadId = url.pathname.split('/').pop();
+      const { data: lead, error } = await supabase.client
+        .from('leads')
+        .update({
+          status: 'sold',
+          updated_at: new Date().toISOString(),
+          notes: { video_felicitacion_generado: null } // Reset para probar
+        })
+        .eq('id', leadId)
+        .select()
+        .single();
+
+      if (error) {
+        return corsResponse(JSON.stringify({ error: error.message }), 400);
+      }
+      return corsResponse(JSON.stringify({
+        message: 'Lead actualizado a sold',
+        lead: { id: lead.id, name: lead.name, status: lead.status, property_interest: lead.property_interest }
+      }, null, 2));
+    }
+
+    // Forzar ejecución de video post-venta
+    if (url.pathname === '/run-video-postventa') {
+      console.log('🎬 Forzando ejecución de video post-venta...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await videoFelicitacionPostVenta(supabase, meta, env);
+      return corsResponse(JSON.stringify({ message: 'Video post-venta ejecutado. Revisa /debug-videos para ver el estado.' }));
+    }
+
+    if (url.pathname === '/run-video-bienvenida') {
+      console.log('🎬 Forzando ejecución de video bienvenida...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await videoBienvenidaLeadNuevo(supabase, meta, env);
+      return corsResponse(JSON.stringify({ message: 'Video bienvenida ejecutado. Revisa /debug-videos para ver el estado.' }));
+    }
+
+    // Reset recursos para un lead (para reenviar videos)
+    if (url.pathname === '/reset-lead-resources') {
+      const body = await request.json() as any;
+      const phone = body.phone;
+      if (!phone) {
+        return corsResponse(JSON.stringify({ error: 'Se requiere phone' }), 400);
+      }
+
+      const digits = phone.replace(/\D/g, '').slice(-10);
+      const { data: lead, error } = await supabase.client
+        .from('leads')
+        .select('id, name, resources_sent, resources_sent_for')
+        .like('phone', '%' + digits)
+        .single();
+
+      if (error || !lead) {
+        return corsResponse(JSON.stringify({ error: 'Lead no encontrado', phone }), 404);
+      }
+
+      // Resetear las columnas resources_sent
+      await supabase.client
+        .from('leads')
+        .update({
+          resources_sent: false,
+          resources_sent_for: null
+        })
+        .eq('id', lead.id);
+
+      return corsResponse(JSON.stringify({
+        success: true,
+        message: `Recursos reseteados para ${lead.name}`,
+        lead_id: lead.id,
+        antes: { resources_sent: lead.resources_sent, resources_sent_for: lead.resources_sent_for }
+      }));
+    }
+
+    if (url.pathname === '/run-lead-scoring') {
+      console.log('📊 Forzando actualización de lead scores...');
+      await actualizarLeadScores(supabase);
+
+      // Mostrar resumen de scores
+      const { data: leads } = await supabase.client
+        .from('leads')
+        .select('name, score, lead_category, status')
+        .not('status', 'in', '("closed","delivered","lost","fallen")')
+        .order('score', { ascending: false })
+        .limit(20);
+
+      return corsResponse(JSON.stringify({
+        message: 'Lead scoring ejecutado',
+        top_leads: leads?.map(l => ({
+          nombre: l.name,
+          score: l.score,
+          categoria: l.lead_category,
+          status: l.status
+        }))
+      }, null, 2));
+    }
+
+    if (url.pathname === '/run-followup-postvisita') {
+      console.log('📍 Forzando follow-up post-visita...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await followUpPostVisita(supabase, meta);
+      return corsResponse(JSON.stringify({ message: 'Follow-up post-visita ejecutado.' }));
+    }
+
+    if (url.pathname === '/run-nurturing') {
+      console.log('📚 Forzando nurturing educativo...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await nurturingEducativo(supabase, meta);
+      return corsResponse(JSON.stringify({ message: 'Nurturing educativo ejecutado.' }));
+    }
+
+    if (url.pathname === '/run-referidos') {
+      console.log('🤝 Forzando solicitud de referidos...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await solicitarReferidos(supabase, meta);
+      return corsResponse(JSON.stringify({ message: 'Solicitud de referidos ejecutada.' }));
+    }
+
+    if (url.pathname === '/run-nps') {
+      console.log('📊 Forzando envío de encuestas NPS...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      const resultado = await enviarEncuestaNPS(supabase, meta);
+      return corsResponse(JSON.stringify({
+        message: 'Encuestas NPS',
+        elegibles: resultado.elegibles,
+        enviados: resultado.enviados,
+        detalles: resultado.detalles
+      }));
+    }
+
+    if (url.pathname === '/run-post-entrega') {
+      console.log('🔑 Forzando seguimiento post-entrega...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await seguimientoPostEntrega(supabase, meta);
+      return corsResponse(JSON.stringify({ message: 'Seguimiento post-entrega ejecutado.' }));
+    }
+
+    if (url.pathname === '/run-satisfaccion-casa') {
+      console.log('🏡 Forzando encuesta de satisfacción con la casa...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await encuestaSatisfaccionCasa(supabase, meta);
+      return corsResponse(JSON.stringify({ message: 'Encuestas de satisfacción con la casa enviadas.' }));
+    }
+
+    if (url.pathname === '/run-mantenimiento') {
+      console.log('🔧 Forzando check-in de mantenimiento...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await checkInMantenimiento(supabase, meta);
+      return corsResponse(JSON.stringify({ message: 'Check-in de mantenimiento ejecutado.' }));
+    }
+
+    if (url.pathname === '/run-health-monitor') {
+      console.log('🏥 Forzando health monitor...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      const result = await healthMonitorCron(supabase, meta, env);
+      return corsResponse(JSON.stringify({ message: 'Health monitor ejecutado', ...result }));
+    }
+
+    // Backup incremental manual: ?tables=leads,appointments&snapshot=1 fuerza snapshot completo
+    if (url.pathname === '/run-backup-incremental') {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+      if (!env.SARA_BACKUPS) {
+        return corsResponse(JSON.stringify({ error: 'R2 bucket SARA_BACKUPS no configurado' }), 500);
+      }
+      const tables = url.searchParams.get('tables')?.split(',').filter(t => INCREMENTAL_BACKUP_TABLES.includes(t));
+      const results = await createIncrementalBackup(supabase, env.SARA_BACKUPS).run(
+        tables && tables.length > 0 ? tables : INCREMENTAL_BACKUP_TABLES,
+        { forceSnapshot: url.searchParams.get('snapshot') === '1' }
+      );
+      return corsResponse(JSON.stringify({ message: 'Backup incremental ejecutado', results }, null, 2));
+    }
+
+    // Restore: reproduce snapshot + deltas. Sin confirm=1 solo cuenta (dry run)
+    if (url.pathname === '/restore-backup') {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+      if (!env.SARA_BACKUPS) {
+        return corsResponse(JSON.stringify({ error: 'R2 bucket SARA_BACKUPS no configurado' }), 500);
+      }
+      const table = url.searchParams.get('table') || '';
+      if (!INCREMENTAL_BACKUP_TABLES.includes(table)) {
+        return corsResponse(JSON.stringify({ error: `table debe ser una de: ${INCREMENTAL_BACKUP_TABLES.join(', ')}` }), 400);
+      }
+      const backup = createIncrementalBackup(supabase, env.SARA_BACKUPS);
+      const result = await backup.restoreTable(table, { dryRun: url.searchParams.get('confirm') !== '1' });
+      return corsResponse(JSON.stringify({ ...result, plan: await backup.restorePlan(table) }, null, 2));
+    }
+
+    if (url.pathname === '/run-backup') {
+      console.log('💾 Forzando backup R2...');
+      if (!env.SARA_BACKUPS) {
+        return corsResponse(JSON.stringify({ error: 'R2 bucket SARA_BACKUPS no configurado' }), 500);
+      }
+      const result = await backupSemanalR2(supabase, env.SARA_BACKUPS);
+      return corsResponse(JSON.stringify({
+        message: 'Backup R2 ejecutado',
+        conversations: { rows: result.conversations.rows, size_kb: Math.round(result.conversations.bytes / 1024) },
+        leads: { rows: result.leads.rows, size_kb: Math.round(result.leads.bytes / 1024) }
+      }, null, 2));
+    }
+
+    // ═══════════════════════════════════════════════════════════════════════
+    // CHECKLIST PRE-VUELO — Verificación de columna vertebral de SARA
+    // Like a pilot's pre-flight checklist: verifies REAL production systems
+    // ═══════════════════════════════════════════════════════════════════════
+    if (url.pathname === '/checklist') {
+      const startTime = Date.now();
+      type CheckResult = { name: string; status: '✅' | '❌' | '⚠️'; detail: string; ms?: number };
+      const checks: CheckResult[] = [];
+
+      const runCheck = async (name: string, fn: () => Promise<{ ok: boolean; warn?: boolean; detail: string }>) => {
+        const t0 = Date.now();
+        try {
+          const result = await fn();
+          checks.push({
+            name,
+            status: result.ok ? '✅' : result.warn ? '⚠️' : '❌',
+            detail: result.detail,
+            ms: Date.now() - t0
+          });
+        } catch (e: any) {
+          checks.push({ name, status: '❌', detail: `EXCEPTION: ${e.message}`, ms: Date.now() - t0 });
+        }
+      };
+
+      // ── 1. DB: Properties table readable with correct columns ──
+      await runCheck('DB: Properties (SELECT columns)', async () => {
+        const { data, error } = await supabase.client
+          .from('properties')
+          .select('id, name, development, price, price_equipped')
+          .limit(1);
+        if (error) return { ok: false, detail: `SELECT failed: ${error.message} — CRON de precios NO funcionará` };
+        return { ok: true, detail: `OK — columns id,name,development,price,price_equipped exist` };
+      });
+
+      // ── 2. DB: All CASAS properties have valid prices (terrenos excluded) ──
+      await runCheck('DB: Precios válidos (casas, price > 0)', async () => {
+        const { data, error } = await supabase.client
+          .from('properties')
+          .select('id, name, development, price, price_equipped');
+        if (error) return { ok: false, detail: `SELECT failed: ${error.message}` };
+        // Terrenos (Citadella del Nogal) don't have price/price_equipped — they use price per m²
+        const casas = (data || []).filter((p: any) => !p.name?.toLowerCase().includes('terreno') && p.development !== 'Citadella del Nogal');
+        const broken = casas.filter((p: any) => !p.price || p.price <= 0 || !p.price_equipped || p.price_equipped <= 0);
+        if (broken.length > 0) {
+          return { ok: false, detail: `${broken.length} casas sin precio: ${broken.map((p: any) => p.name).join(', ')}` };
+        }
+        return { ok: true, detail: `${casas.length} casas con precios válidos (${(data || []).length - casas.length} terrenos excluidos)` };
+      });
+
+      // ── 3. DB: Price sanity (no property under $500K or over $20M) ──
+      await runCheck('DB: Precios en rango razonable ($500K-$20M)', async () => {
+        const { data } = await supabase.client
+          .from('properties')
+          .select('name, price, price_equipped');
+        const outliers = (data || []).filter((p: any) =>
+          (p.price && (p.price < 500000 || p.price > 20000000)) ||
+          (p.price_equipped && (p.price_equipped < 500000 || p.price_equipped > 20000000))
+        );
+        if (outliers.length > 0) {
+          return { ok: false, detail: `Precios fuera de rango: ${outliers.map((p: any) => `${p.name}=$${p.price}`).join(', ')}` };
+        }
+        return { ok: true, detail: `Todos en rango $500K-$20M` };
+      });
+
+      // ── 4. DB: Team members activos ──
+      await runCheck('DB: Team members activos', async () => {
+        const { data, error } = await supabase.client
+          .from('team_members')
+          .select('id, name, role, active')
+          .eq('active', true);
+        if (error) return { ok: false, detail: `SELECT failed: ${error.message}` };
+        if (!data || data.length === 0) return { ok: false, detail: 'No hay team members activos!' };
+        const roles = [...new Set(data.map((t: any) => t.role))];
+        return { ok: true, detail: `${data.length} activos, roles: ${roles.join(', ')}` };
+      });
+
+      // ── 5. DB: Leads table readable ──
+      await runCheck('DB: Leads table', async () => {
+        const { count, error } = await supabase.client
+          .from('leads')
+          .select('id', { count: 'exact', head: true });
+        if (error) return { ok: false, detail: `SELECT failed: ${error.message}` };
+        return { ok: true, detail: `${count} leads en DB` };
+      });
+
+      // ── 6. KV Cache: read/write ──
+      await runCheck('KV Cache: read/write', async () => {
+        if (!env.SARA_CACHE) return { ok: false, detail: 'SARA_CACHE KV not bound' };
+        const testKey = `checklist_test_${Date.now()}`;
+        await env.SARA_CACHE.put(testKey, 'ok', { expirationTtl: 60 });
+        const val = await env.SARA_CACHE.get(testKey);
+        await env.SARA_CACHE.delete(testKey);
+        if (val !== 'ok') return { ok: false, detail: `KV write/read mismatch: got ${val}` };
+        return { ok: true, detail: 'Put + Get + Delete OK' };
+      });
+
+      // ── 7. KV: Price increase idempotency key status ──
+      await runCheck('CRON: Idempotencia precio mensual', async () => {
+        if (!env.SARA_CACHE) return { ok: false, detail: 'No KV' };
+        const now = new Date();
+        const mesKey = `${now.getFullYear()}-${String(now.getMonth() + 1).padStart(2, '0')}`;
+        const kvVal = await env.SARA_CACHE.get(`price_increase_${mesKey}`);
+        const dayOfMonth = parseInt(new Intl.DateTimeFormat('en-US', { timeZone: 'America/Mexico_City', day: 'numeric' }).format(now));
+        if (dayOfMonth >= 2 && !kvVal) {
+          return { ok: false, warn: true, detail: `Mes ${mesKey}, día ${dayOfMonth} — KV key NO existe. ¿No corrió el CRON el día 1?` };
+        }
+        if (dayOfMonth === 1 && !kvVal) {
+          return { ok: true, detail: `Mes ${mesKey}, día 1 — pendiente de ejecutar hoy` };
+        }
+        return { ok: true, detail: `Mes ${mesKey} — ${kvVal ? 'Ya aplicado ✓' : 'Pendiente (día 1)'}` };
+      });
+
+      // ── 8. Meta WhatsApp API: token válido ──
+      await runCheck('WhatsApp: Meta API token', async () => {
+        if (!env.META_ACCESS_TOKEN || !env.META_PHONE_NUMBER_ID) {
+          return { ok: false, detail: 'META_ACCESS_TOKEN o META_PHONE_NUMBER_ID no configurado' };
+        }
+        const resp = await fetch(`https://graph.facebook.com/v21.0/${env.META_PHONE_NUMBER_ID}`, {
+          headers: { Authorization: `Bearer ${env.META_ACCESS_TOKEN}` }
+        });
+        if (!resp.ok) {
+          const body = await resp.text();
+          if (body.includes('OAuthException') || resp.status === 401) {
+            return { ok: false, detail: `TOKEN EXPIRADO — status ${resp.status}` };
+          }
+          return { ok: false, detail: `Meta API error: ${resp.status}` };
+        }
+        return { ok: true, detail: 'Token válido, API responde' };
+      });
+
+      // ── 9. Retell: agente configurado ──
+      await runCheck('Retell: Agente IA', async () => {
+        if (!env.RETELL_API_KEY || !env.RETELL_AGENT_ID) {
+          return { ok: false, warn: true, detail: 'RETELL_API_KEY o RETELL_AGENT_ID no configurado' };
+        }
+        const resp = await fetch(`https://api.retellai.com/get-agent/${env.RETELL_AGENT_ID}`, {
+          headers: { Authorization: `Bearer ${env.RETELL_API_KEY}` }
+        });
+        if (!resp.ok) return { ok: false, detail: `Retell API error: ${resp.status}` };
+        const agent = await resp.json() as any;
+        return { ok: true, detail: `Agente "${agent.agent_name || env.RETELL_AGENT_ID}" activo` };
+      });
+
+      // ── 10. Google Calendar: can list events ──
+      await runCheck('Google Calendar: API funciona', async () => {
+        try {
+          const cal = new CalendarService(env.GOOGLE_SERVICE_ACCOUNT_EMAIL, env.GOOGLE_PRIVATE_KEY, env.GOOGLE_CALENDAR_ID);
+          const now = new Date();
+          const nextWeek = new Date(now.getTime() + 7 * 24 * 60 * 60 * 1000);
+          const events = await cal.getEvents(now.toISOString(), nextWeek.toISOString(), 5);
+          return { ok: true, detail: `API OK, ${events.length} eventos próxima semana` };
+        } catch (e: any) {
+          return { ok: false, detail: `Calendar error: ${e.message}` };
+        }
+      });
+
+      // ── 11. Brochures: all developments have properties with prices in DB ──
+      await runCheck('Brochures: Datos por desarrollo', async () => {
+        const expectedDevs = ['Monte Verde', 'Andes', 'Distrito Falco', 'Los Encinos', 'Miravalle', 'Paseo Colorines', 'Alpes'];
+        const { data: allProps } = await supabase.client
+          .from('properties')
+          .select('name, development, price, price_equipped');
+        if (!allProps) return { ok: false, detail: 'No se pudieron leer propiedades' };
+        const failures: string[] = [];
+        for (const dev of expectedDevs) {
+          const props = allProps.filter((p: any) => p.development === dev);
+          if (props.length === 0) { failures.push(`${dev}: 0 propiedades`); continue; }
+          const sinPrecio = props.filter((p: any) => !p.price_equipped || p.price_equipped <= 0);
+          if (sinPrecio.length > 0) failures.push(`${dev}: ${sinPrecio.length} sin precio`);
+        }
+        if (failures.length > 0) return { ok: false, detail: failures.join('; ') };
+        return { ok: true, detail: `${expectedDevs.length} desarrollos OK con propiedades y precios` };
+      });
+
+      // ── 11. AI: SARA responde sin errores ──
+      await runCheck('IA: SARA responde', async () => {
+        try {
+          const claude = new ClaudeService(env.ANTHROPIC_API_KEY);
+          const meta2 = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+          const calendar = new CalendarService(env.GOOGLE_SERVICE_ACCOUNT_EMAIL, env.GOOGLE_PRIVATE_KEY, env.GOOGLE_CALENDAR_ID);
+          const aiService = new AIConversationService(supabase, null as any, meta2, calendar, claude, env);
+          const { data: properties } = await supabase.client.from('properties').select('*');
+          const testLead = { id: 'checklist-test', name: 'Test Checklist', phone: '0000000000', status: 'new', notes: {}, resources_sent_for: null, conversation_history: [] };
+          const analysis = await aiService.analyzeWithAI('Hola, quiero información de casas', testLead as any, properties || []);
+          if (!analysis?.response || analysis.response.length < 10) return { ok: false, detail: `Respuesta vacía o muy corta` };
+          return { ok: true, detail: `Responde OK (${analysis.response.length} chars)` };
+        } catch (e: any) {
+          if (e.message?.includes('api_key') || e.message?.includes('401')) {
+            return { ok: false, detail: `ANTHROPIC_API_KEY inválida: ${e.message}` };
+          }
+          return { ok: false, detail: `Error IA: ${e.message}` };
+        }
+      });
+
+      // ── 12. Fact Validator: no claims alberca ──
+      await runCheck('Fact Validator: Alberca correction', async () => {
+        try {
+          const { validateFacts } = await import('../services/factValidator');
+          const testResponse = 'Andes tiene alberca y es genial para tu familia';
+          const result = validateFacts(testResponse);
+          if (result.response.toLowerCase().includes('tiene alberca')) {
+            return { ok: false, detail: `Fact validator NO corrigió claim de alberca: "${result.response}"` };
+          }
+          if (result.corrections.length === 0) {
+            return { ok: false, detail: 'Fact validator no detectó el error de alberca' };
+          }
+          return { ok: true, detail: `Corrige alberca OK (${result.corrections.length} corrección(es))` };
+        } catch (e: any) {
+          return { ok: false, detail: `Error factValidator: ${e.message}` };
+        }
+      });
+
+      // ── 13. Multi-tenant: tablas y RPC ──
+      await runCheck('Multi-tenant: tenants + RLS', async () => {
+        try {
+          const { data: tenants, error: tErr } = await supabase.client.from('tenants').select('id, slug, active').eq('active', true);
+          if (tErr) return { ok: false, detail: `tenants query error: ${tErr.message}` };
+          if (!tenants?.length) return { ok: false, detail: 'No active tenants found' };
+
+          // Verify set_tenant RPC works
+          const { error: rpcErr } = await supabase.client.rpc('set_tenant', { tid: '00000000-0000-0000-0000-000000000001' });
+          if (rpcErr) return { ok: false, detail: `set_tenant RPC error: ${rpcErr.message}` };
+
+          // Check SaaS tables exist
+          const saasTables = ['auth_users', 'billing_events', 'invitations', 'usage_metrics'];
+          const missing: string[] = [];
+          for (const tbl of saasTables) {
+            const { error } = await supabase.client.from(tbl).select('id').limit(1);
+            if (error && error.code !== 'PGRST116') missing.push(tbl);
+          }
+          if (missing.length > 0) return { ok: false, detail: `SaaS tables missing: ${missing.join(', ')}` };
+
+          return { ok: true, detail: `${tenants.length} tenant(s) activo(s), RPC OK, 4 SaaS tables OK` };
+        } catch (e: any) {
+          return { ok: false, detail: `Multi-tenant error: ${e.message}` };
+        }
+      });
+
+      // ── 14. Environment: variables críticas ──
+      await runCheck('Env: Variables críticas', async () => {
+        const required = ['SUPABASE_URL', 'SUPABASE_ANON_KEY', 'META_ACCESS_TOKEN', 'META_PHONE_NUMBER_ID', 'ANTHROPIC_API_KEY', 'API_SECRET'];
+        const missing = required.filter(k => !(env as any)[k]);
+        if (missing.length > 0) return { ok: false, detail: `Faltan: ${missing.join(', ')}` };
+        return { ok: true, detail: `${required.length} variables OK` };
+      });
+
+      // ── RESULTS ──
+      const failed = checks.filter(c => c.status === '❌');
+      const warned = checks.filter(c => c.status === '⚠️');
+      const passed = checks.filter(c => c.status === '✅');
+
+      const summary = {
+        timestamp: new Date().toISOString(),
+        verdict: failed.length === 0 ? (warned.length === 0 ? '🟢 ALL CLEAR' : '🟡 WARNINGS') : '🔴 FAILED',
+        summary: `${passed.length}/${checks.length} passed, ${warned.length} warnings, ${failed.length} failed`,
+        duration_ms: Date.now() - startTime,
+        checks: checks.map(c => ({ [`${c.status} ${c.name}`]: c.detail, ms: c.ms })),
+        ...(failed.length > 0 ? { CRITICAL_FAILURES: failed.map(f => `${f.name}: ${f.detail}`) } : {}),
+        ...(warned.length > 0 ? { WARNINGS: warned.map(w => `${w.name}: ${w.detail}`) } : {})
+      };
+
+      return corsResponse(JSON.stringify(summary, null, 2));
+    }
+
+    if (url.pathname === '/run-price-increase') {
+      console.log('💰 Forzando incremento de precios...');
+      const force = url.searchParams.get('force') === '1';
+      if (force && env.SARA_CACHE) {
+        // Clear idempotency key to force re-run
+        const mesKey = `${new Date().getFullYear()}-${String(new Date().getMonth() + 1).padStart(2, '0')}`;
+        await env.SARA_CACHE.delete(`price_increase_${mesKey}`);
+        console.log('🔄 Idempotency key cleared (force mode)');
+      }
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await aplicarPreciosProgramados(supabase, meta, env);
+      return corsResponse(JSON.stringify({ message: 'Incremento de precios ejecutado (+0.5%)' }));
+    }
+
+    // Ver aprobaciones pendientes
+    if (url.pathname === '/api/followup-approvals') {
+      const vendedorPhone = url.searchParams.get('vendedor_phone');
+      const vendedorId = url.searchParams.get('vendedor_id');
+      const leadId = url.searchParams.get('lead_id');
+      const status = url.searchParams.get('status'); // null = todos
+      const desde = url.searchParams.get('desde'); // fecha ISO
+      const hasta = url.searchParams.get('hasta'); // fecha ISO
+
+      let query = supabase.client
+        .from('followup_approvals')
+        .select('*, team_members:vendedor_id(name, phone)')
+        .order('created_at', { ascending: false })
+        .limit(100);
+
+      if (status) {
+        query = query.eq('status', status);
+      }
+      if (vendedorId) {
+        query = query.eq('vendedor_id', vendedorId);
+      }
+      if (leadId) {
+        query = query.eq('lead_id', leadId);
+      }
+      if (vendedorPhone) {
+        const cleanPhone = vendedorPhone.replace(/\D/g, '');
+        query = query.like('vendedor_phone', `%${cleanPhone.slice(-10)}`);
+      }
+      if (desde) {
+        query = query.gte('created_at', desde);
+      }
+      if (hasta) {
+        query = query.lte('created_at', hasta);
+      }
+
+      const { data, error } = await query;
+      if (error) {
+        return corsResponse(JSON.stringify({ error: error.message }), 500);
+      }
+      return corsResponse(JSON.stringify({ ok: true, approvals: data, count: data?.length || 0 }));
+    }
+
+    // Estadísticas de follow-ups (para dashboard CRM)
+    if (url.pathname === '/api/followup-stats') {
+      const hoy = new Date();
+      const inicioHoy = new Date(hoy.getFullYear(), hoy.getMonth(), hoy.getDate()).toISOString();
+      const hace7Dias = new Date(hoy.getTime() - 7 * 24 * 60 * 60 * 1000).toISOString();
+      const hace30Dias = new Date(hoy.getTime() - 30 * 24 * 60 * 60 * 1000).toISOString();
+
+      // Stats de hoy
+      const { data: hoyData } = await supabase.client
+        .from('followup_approvals')
+        .select('status')
+        .gte('created_at', inicioHoy);
+
+      // Stats últimos 7 días
+      const { data: semanaData } = await supabase.client
+        .from('followup_approvals')
+        .select('status')
+        .gte('created_at', hace7Dias);
+
+      // Stats últimos 30 días
+      const { data: mesData } = await supabase.client
+        .from('followup_approvals')
+        .select('status, vendedor_id')
+        .gte('created_at', hace30Dias);
+
+      // Pendientes actuales
+      const { data: pendientesData } = await supabase.client
+        .from('followup_approvals')
+        .select('vendedor_id, lead_name, created_at')
+        .eq('status', 'pending');
+
+      const calcStats = (data: any[]) => ({
+        total: data?.length || 0,
+        enviados: data?.filter(d => d.status === 'sent').length || 0,
+        aprobados: data?.filter(d => d.status === 'approved').length || 0,
+        editados: data?.filter(d => d.status === 'edited').length || 0,
+        rechazados: data?.filter(d => d.status === 'rejected').length || 0,
+        pendientes: data?.filter(d => d.status === 'pending').length || 0,
+        expirados: data?.filter(d => d.status === 'expired').length || 0
+      });
+
+      // Ranking por vendedor (últimos 30 días)
+      const porVendedor: Record<string, {enviados: number, rechazados: number}> = {};
+      mesData?.forEach(d => {
+        if (!porVendedor[d.vendedor_id]) {
+          porVendedor[d.vendedor_id] = { enviados: 0, rechazados: 0 };
+        }
+        if (d.status === 'sent') porVendedor[d.vendedor_id].enviados++;
+        if (d.status === 'rejected') porVendedor[d.vendedor_id].rechazados++;
+      });
+
+      return corsResponse(JSON.stringify({
+        ok: true,
+        hoy: calcStats(hoyData || []),
+        semana: calcStats(semanaData || []),
+        mes: calcStats(mesData || []),
+        pendientes_actuales: pendientesData?.length || 0,
+        pendientes_detalle: pendientesData?.slice(0, 10) || [],
+        por_vendedor: porVendedor
+      }));
+    }
+
+    // Ver todas las encuestas
+    if (url.pathname === '/surveys') {
+      const { data } = await supabase.client
+        .from('surveys')
+        .select('*')
+        .order('created_at', { ascending: false })
+        .limit(50);
+      return corsResponse(JSON.stringify(data || []));
+    }
+
+    // Forzar flujo post-visita (pregunta al vendedor)
+    if (url.pathname === '/test-flujo-postvisita' || url.pathname === '/run-flujo-postvisita') {
+      console.log('🧪 TEST: Forzando flujo post-visita...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await iniciarFlujosPostVisita(supabase, meta, env.SARA_CACHE);
+      return corsResponse(JSON.stringify({ ok: true, message: 'Flujo post-visita ejecutado' }));
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // ENVIAR ENCUESTAS DESDE CRM (con plantillas personalizadas)
+    // ═══════════════════════════════════════════════════════════
+    if (url.pathname === '/api/send-surveys' && request.method === 'POST') {
+      try {
+        const body = await request.json() as {
+          template: {
+            id: string
+            name: string
+            type: string
+            greeting: string
+            questions: { text: string; type: string }[]
+            closing: string
+          }
+          leads: { id: string; phone: string; name: string }[]
+          message?: string
+          targetType?: 'leads' | 'vendedores' | 'manual'
+        };
+
+        const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+        const { template, leads, message, targetType } = body;
+        const isVendedores = targetType === 'vendedores';
+
+        console.log(`📋 Enviando encuesta "${template.name}" a ${leads.length} ${isVendedores ? 'vendedores' : 'leads'}...`);
+
+        let enviados = 0;
+        let errores = 0;
+
+        for (const lead of leads) {
+          try {
+            if (!lead.phone) {
+              console.error(`⚠️ ${lead.name} sin teléfono, saltando...`);
+              continue;
+            }
+
+            // Personalizar mensaje con nombre
+            const nombreCliente = lead.name?.split(' ')[0] || 'Cliente';
+            const saludo = template.greeting.replace('{nombre}', nombreCliente);
+
+            // NUEVO: Enviar solo la PRIMERA pregunta (flujo secuencial)
+            const primeraQ = template.questions[0];
+            let mensajeEncuesta = `${saludo}\n\n`;
+
+            if (primeraQ) {
+              if (primeraQ.type === 'rating') {
+                // NPS usa escala 0-10, otros ratings 1-5
+                const esNPS = template.type === 'nps' || primeraQ.text.toLowerCase().includes('0 al 10');
+                mensajeEncuesta += `${primeraQ.text}\n_Responde del ${esNPS ? '0 al 10' : '1 al 5'}_`;
+              } else if (primeraQ.type === 'yesno') {
+                mensajeEncuesta += `${primeraQ.text}\n_Responde SI o NO_`;
+              } else {
+                mensajeEncuesta += `${primeraQ.text}`;
+              }
+            }
+
+            // Agregar mensaje adicional si existe
+            if (message) {
+              mensajeEncuesta = `${message}\n\n${mensajeEncuesta}`;
+            }
+
+            // Enviar por WhatsApp
+            console.log(`📤 Enviando encuesta a ${lead.name} (${lead.phone})...`);
+            await meta.sendWhatsAppMessage(lead.phone, mensajeEncuesta);
+
+            // Registrar en base de datos
+            const validSurveyTypes = ['nps', 'post_cita'];
+            const surveyType = validSurveyTypes.includes(template.type) ? template.type : 'nps';
+
+            // Preparar datos - NO usar lead_id para evitar foreign key errors
+            // Solo usamos lead_phone para matching de respuestas
+            const surveyData: any = {
+              lead_phone: lead.phone,
+              lead_name: lead.name,
+              survey_type: surveyType,
+              status: 'sent',
+              sent_at: new Date().toISOString(),
+              expires_at: new Date(Date.now() + 7 * 24 * 60 * 60 * 1000).toISOString()
+            };
+
+            if (isVendedores) {
+              // Para vendedores: usar vendedor_id y vendedor_name
+              surveyData.vendedor_id = lead.id;
+              surveyData.vendedor_name = lead.name;
+            }
+            // NO agregamos lead_id - evita foreign key constraint errors
+            // El matching de respuestas usa lead_phone, no necesitamos lead_id
+
+            console.log(`💾 Guardando encuesta en DB para ${lead.phone} (tipo: ${surveyType}, isVendedor: ${isVendedores})...`);
+            const { error: insertError } = await supabase.client.from('surveys').insert(surveyData);
+
+            if (insertError) {
+              console.error(`❌ Error guardando encuesta en DB:`, insertError);
+            } else {
+              console.log(`✅ Encuesta guardada en DB para ${lead.phone}`);
+            }
+
+            console.log(`✅ Encuesta enviada a ${lead.name}`);
+            enviados++;
+
+            // Rate limiting
+            await new Promise(r => setTimeout(r, 1000));
+          } catch (e) {
+            console.error(`❌ Error enviando a ${lead.name}:`, e);
+            errores++;
+          }
+        }
+
+        console.log(`📊 Encuestas: ${enviados} enviadas, ${errores} errores`);
+
+        return corsResponse(JSON.stringify({
+          ok: true,
+          enviados,
+          errores,
+          message: `Encuesta "${template.name}" enviada a ${enviados} leads`
+        }));
+      } catch (e) {
+        console.error('Error en /api/send-surveys:', e);
+        return corsResponse(JSON.stringify({ ok: false, error: 'Error procesando encuestas' }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // FORZAR ENVÍO DE VIDEOS PENDIENTES
+    // ═══════════════════════════════════════════════════════════
+    if (url.pathname === '/force-send-videos') {
+      console.log('🎬 Forzando envío de videos pendientes...');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await verificarVideosPendientes(supabase, meta, env);
+      return corsResponse(JSON.stringify({ ok: true, message: 'Videos pendientes procesados' }));
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // API: OBTENER ENCUESTAS
+    // ═══════════════════════════════════════════════════════════
+    if (url.pathname === '/api/surveys' || url.pathname === '/pending-surveys') {
+      const status = url.searchParams.get('status'); // all, sent, answered, awaiting_feedback
+      const limit = parseInt(url.searchParams.get('limit') || '50');
+
+      let query = supabase.client
+        .from('surveys')
+        .select('*')
+        .order('sent_at', { ascending: false })
+        .limit(limit);
+
+      if (status && status !== 'all') {
+        query = query.eq('status', status);
+      }
+
+      const { data } = await query;
+
+      // Calcular métricas
+      const allSurveys = data || [];
+      const answered = allSurveys.filter(s => s.status === 'answered');
+      const npsScores = answered.filter(s => s.nps_score !== null).map(s => s.nps_score);
+
+      const metrics = {
+        total: allSurveys.length,
+        sent: allSurveys.filter(s => s.status === 'sent').length,
+        awaiting_feedback: allSurveys.filter(s => s.status === 'awaiting_feedback').length,
+        answered: answered.length,
+        avg_nps: npsScores.length > 0 ? (npsScores.reduce((a, b) => a + b, 0) / npsScores.length).toFixed(1) : null,
+        promoters: npsScores.filter(s => s >= 9).length,
+        passives: npsScores.filter(s => s >= 7 && s < 9).length,
+        detractors: npsScores.filter(s => s < 7).length
+      };
+
+      return corsResponse(JSON.stringify({ surveys: allSurveys, metrics }));
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // Crear tabla sara_logs
+    if (url.pathname === '/create-logs-table') {
+      const sql = `CREATE TABLE IF NOT EXISTS sara_logs (id uuid DEFAULT gen_random_uuid() PRIMARY KEY, tipo text NOT NULL, mensaje text NOT NULL, datos jsonb DEFAULT '{}', created_at timestamptz DEFAULT now()); CREATE INDEX IF NOT EXISTS idx_sara_logs_created_at ON sara_logs(created_at DESC); CREATE INDEX IF NOT EXISTS idx_sara_logs_tipo ON sara_logs(tipo);`;
+      return corsResponse(JSON.stringify({
+        instruccion: 'Copia y pega este SQL en Supabase Dashboard > SQL Editor > New Query > Run',
+        sql: sql,
+        url_supabase: 'https://supabase.com/dashboard/project/_/sql/new'
+      }));
+    }
+
+    // Ver logs de SARA
+    if (url.pathname === '/logs') {
+      const horas = parseInt(url.searchParams.get('horas') || '24');
+      const tipo = url.searchParams.get('tipo');
+      const desde = new Date(Date.now() - horas * 60 * 60 * 1000).toISOString();
+      let query = supabase.client.from('sara_logs').select('*').gte('created_at', desde).order('created_at', { ascending: false }).limit(100);
+      if (tipo) query = query.eq('tipo', tipo);
+      const { data: logs, error } = await query;
+      if (error) return corsResponse(JSON.stringify({ error: error.message }), 500);
+      return corsResponse(JSON.stringify({ total: logs?.length || 0, desde, logs: logs || [] }));
+    }
+
+    // Enviar TEMPLATE a un teléfono (para fuera de ventana 24h)
+    if (url.pathname === '/send-template') {
+      const authError = checkApiAuth(request, env);
+      if (authError) return authError;
+
+      const phone = url.searchParams.get('phone');
+      const template = url.searchParams.get('template') || 'reactivar_equipo';
+      const nombre = url.searchParams.get('nombre') || 'amigo';
+      if (!phone) {
+        return corsResponse(JSON.stringify({ error: 'Falta phone' }), 400);
+      }
+      try {
+        const response = await fetch(`https://graph.facebook.com/v18.0/${env.META_PHONE_NUMBER_ID}/messages`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${env.META_ACCESS_TOKEN}`,
+            'Content-Type': 'application/json'
+          },
+          body: JSON.stringify({
+            messaging_product: 'whatsapp',
+            to: phone,
+            type: 'template',
+            template: {
+              name: template,
+              language: { code: 'es_MX' },
+              components: [{ type: 'body', parameters: [{ type: 'text', text: nombre }] }]
+            }
+          })
+        });
+        const result = await response.json();
+        return corsResponse(JSON.stringify({ ok: response.ok, status: response.status, phone, template, meta_response: result }));
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ error: e.message, phone }), 500);
+      }
+    }
+
+    // Enviar mensaje directo a un teléfono (con debug)
+    if (url.pathname === '/send-message') {
+      const phone = url.searchParams.get('phone');
+      const msg = url.searchParams.get('msg');
+      if (!phone || !msg) {
+        return corsResponse(JSON.stringify({ error: 'Falta phone o msg' }), 400);
+      }
+      try {
+        // Llamar directamente a Meta API para ver respuesta completa
+        const response = await fetch(`https://graph.facebook.com/v18.0/${env.META_PHONE_NUMBER_ID}/messages`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${env.META_ACCESS_TOKEN}`,
+            'Content-Type': 'application/json'
+          },
+          body: JSON.stringify({
+            messaging_product: 'whatsapp',
+            to: phone,
+            type: 'text',
+            text: { body: msg }
+          })
+        });
+        const result = await response.json();
+        return corsResponse(JSON.stringify({ ok: response.ok, status: response.status, phone, meta_response: result }));
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ error: e.message, phone }), 500);
+      }
+    }
+
+
+    // ═══════════════════════════════════════════════════════════════
+    // HEALTH CHECK - Estado del sistema
+    // ═══════════════════════════════════════════════════════════════
+    // Root endpoint
+    if (url.pathname === '/') {
+      return corsResponse(JSON.stringify({
+        name: 'SARA Backend',
+        version: '2.0.0',
+        status: 'running',
+        timestamp: new Date().toISOString()
+      }), 200, 'application/json', request);
+    }
+
+    if (url.pathname === '/health') {
+      const health = await runHealthCheck(supabase, env);
+      return corsResponse(JSON.stringify(health));
+    }
+
+    // Detailed system health (requires auth)
+    if (url.pathname === '/api/system-health') {
+      const [healthResult, errorRate] = await Promise.all([
+        runHealthCheck(supabase, env),
+        (async () => {
+          if (!env.SARA_CACHE) return { alertNeeded: false, errorsLastHour: 0, errorsLast2Hours: 0 };
+          const { checkErrorRate } = await import('../crons/healthCheck');
+          return checkErrorRate(env);
+        })()
+      ]);
+
+      // Get last health check from KV
+      let lastCheck = null;
+      if (env.SARA_CACHE) {
+        const cached = await env.SARA_CACHE.get('last_health_check');
+        if (cached) lastCheck = JSON.parse(cached);
+      }
+
+      return corsResponse(JSON.stringify({
+        ...healthResult,
+        errorRate,
+        lastScheduledCheck: lastCheck
+      }));
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // E2E VALIDATE - Run ~30 tests against real services pre-deploy
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/api/validate') {
+      const startTime = Date.now();
+      const results: Array<{ name: string; passed: boolean; details: string }> = [];
+
+      // Helper
+      const addTest = (name: string, passed: boolean, details: string) => {
+        results.push({ name, passed, details });
+      };
+
+      // ── DATABASE TESTS ──
+
+      // 1. Supabase read
+      try {
+        const { count, error } = await supabase.client
+          .from('leads')
+          .select('*', { count: 'exact', head: true });
+        if (error) throw error;
+        addTest('DB: read leads count', true, `${count} leads`);
+      } catch (e: any) {
+        addTest('DB: read leads count', false, e.message);
+      }
+
+      // 2. Team members exist
+      try {
+        const { data, error } = await supabase.client
+          .from('team_members')
+          .select('id, name, role')
+          .eq('active', true);
+        if (error) throw error;
+        const vendedores = data?.filter((t: any) => t.role === 'vendedor').length || 0;
+        addTest('DB: team members', (data?.length || 0) > 0, `${data?.length} active (${vendedores} vendedores)`);
+      } catch (e: any) {
+        addTest('DB: team members', false, e.message);
+      }
+
+      // 3. Properties catalog
+      try {
+        const { count, error } = await supabase.client
+          .from('properties')
+          .select('*', { count: 'exact', head: true });
+        if (error) throw error;
+        addTest('DB: properties catalog', (count || 0) >= 30, `${count} properties`);
+      } catch (e: any) {
+        addTest('DB: properties catalog', false, e.message);
+      }
+
+      // 4. Appointments table accessible
+      try {
+        const { count, error } = await supabase.client
+          .from('appointments')
+          .select('*', { count: 'exact', head: true });
+        if (error) throw error;
+        addTest('DB: appointments table', true, `${count} total appointments`);
+      } catch (e: any) {
+        addTest('DB: appointments table', false, e.message);
+      }
+
+      // 5. DB write + delete (create test lead and remove)
+      try {
+        const testPhone = '5210000099999';
+        const { data: created, error: createErr } = await supabase.client
+          .from('leads')
+          .insert({ phone: testPhone, name: 'E2E_VALIDATE_TEST', status: 'new', source: 'e2e_test' })
+          .select()
+          .single();
+        if (createErr) throw createErr;
+
+        const { error: deleteErr } = await supabase.client
+          .from('leads')
+          .delete()
+          .eq('id', created.id);
+        if (deleteErr) throw deleteErr;
+
+        addTest('DB: write + delete', true, 'Created and deleted test lead');
+      } catch (e: any) {
+        // Cleanup attempt
+        await supabase.client.from('leads').delete().eq('phone', '5210000099999').catch(() => {});
+        addTest('DB: write + delete', false, e.message);
+      }
+
+      // ── CACHE TESTS ──
+
+      // 6. KV write + read + delete
+      if (env.SARA_CACHE) {
+        try {
+          const key = 'e2e_validate_test';
+          const val = `test_${Date.now()}`;
+          await env.SARA_CACHE.put(key, val, { expirationTtl: 60 });
+          const readBack = await env.SARA_CACHE.get(key);
+          await env.SARA_CACHE.delete(key);
+          addTest('Cache: KV write/read/delete', readBack === val, 'KV cycle OK');
+        } catch (e: any) {
+          addTest('Cache: KV write/read/delete', false, e.message);
+        }
+      } else {
+        addTest('Cache: KV write/read/delete', false, 'SARA_CACHE not configured');
+      }
+
+      // ── WHATSAPP TESTS ──
+
+      // 7. Meta API token valid
+      if (env.META_PHONE_NUMBER_ID && env.META_ACCESS_TOKEN) {
+        try {
+          const resp = await fetch(
+            `https://graph.facebook.com/v21.0/${env.META_PHONE_NUMBER_ID}`,
+            { headers: { 'Authorization': `Bearer ${env.META_ACCESS_TOKEN}` } }
+          );
+          addTest('WhatsApp: Meta API token', resp.ok, resp.ok ? 'Token valid' : `Status ${resp.status}`);
+        } catch (e: any) {
+          addTest('WhatsApp: Meta API token', false, e.message);
+        }
+      } else {
+        addTest('WhatsApp: Meta API token', false, 'Not configured');
+      }
+
+      // 8. Phone number ID correct
+      if (env.META_PHONE_NUMBER_ID && env.META_ACCESS_TOKEN) {
+        try {
+          const resp = await fetch(
+            `https://graph.facebook.com/v21.0/${env.META_PHONE_NUMBER_ID}`,
+            { headers: { 'Authorization': `Bearer ${env.META_ACCESS_TOKEN}` } }
+          );
+          if (resp.ok) {
+            const data: any = await resp.json();
+            addTest('WhatsApp: phone number', true,
+              `${data.display_phone_number || 'configured'} (quality: ${data.quality_rating || 'N/A'})`);
+          } else {
+            addTest('WhatsApp: phone number', false, `Status ${resp.status}`);
+          }
+        } catch (e: any) {
+          addTest('WhatsApp: phone number', false, e.message);
+        }
+      } else {
+        addTest('WhatsApp: phone number', false, 'Not configured');
+      }
+
+      // ── AI TESTS ──
+
+      // 9. Claude API responds
+      if (env.ANTHROPIC_API_KEY) {
+        try {
+          const resp = await fetch('https://api.anthropic.com/v1/messages', {
+            method: 'POST',
+            headers: {
+              'x-api-key': env.ANTHROPIC_API_KEY,
+              'anthropic-version': '2023-06-01',
+              'content-type': 'application/json'
+            },
+            body: JSON.stringify({
+              model: 'claude-sonnet-4-5-20250929',
+              max_tokens: 50,
+              messages: [{ role: 'user', content: 'Respond with just OK' }]
+            })
+          });
+          const data: any = await resp.json();
+          const text = data.content?.[0]?.text || '';
+          addTest('AI: Claude API', resp.ok && text.length > 0, text.substring(0, 50));
+        } catch (e: any) {
+          addTest('AI: Claude API', false, e.message);
+        }
+      } else {
+        addTest('AI: Claude API', false, 'ANTHROPIC_API_KEY not configured');
+      }
+
+      // ── RETELL TESTS ──
+
+      // 10. Retell agent exists
+      if (env.RETELL_API_KEY && env.RETELL_AGENT_ID) {
+        try {
+          const resp = await fetch(`https://api.retellai.com/get-agent/${env.RETELL_AGENT_ID}`, {
+            headers: { 'Authorization': `Bearer ${env.RETELL_API_KEY}` }
+          });
+          if (resp.ok) {
+            const agent: any = await resp.json();
+            addTest('Retell: agent config', true, `Agent "${agent.agent_name || agent.agent_id}" found`);
+          } else {
+            addTest('Retell: agent config', false, `Status ${resp.status}`);
+          }
+        } catch (e: any) {
+          addTest('Retell: agent config', false, e.message);
+        }
+      } else {
+        addTest('Retell: agent config', false, 'Retell not configured');
+      }
+
+      // ── API ENDPOINT TESTS ──
+
+      // 11. GET /api/leads
+      try {
+        const { data, error } = await supabase.client
+          .from('leads')
+          .select('id, name, phone, status')
+          .order('created_at', { ascending: false })
+          .limit(5);
+        if (error) throw error;
+        addTest('API: GET leads', true, `${data?.length} leads returned`);
+      } catch (e: any) {
+        addTest('API: GET leads', false, e.message);
+      }
+
+      // 12. GET /api/appointments
+      try {
+        const hoy = new Date().toISOString().split('T')[0];
+        const { data, error } = await supabase.client
+          .from('appointments')
+          .select('id, lead_id, scheduled_date, status')
+          .gte('scheduled_date', hoy)
+          .limit(5);
+        if (error) throw error;
+        addTest('API: GET appointments', true, `${data?.length} upcoming appointments`);
+      } catch (e: any) {
+        addTest('API: GET appointments', false, e.message);
+      }
+
+      // 13. GET /api/properties
+      try {
+        const { data, error } = await supabase.client
+          .from('properties')
+          .select('id, name, price, price_equipped')
+          .limit(5);
+        if (error) throw error;
+        addTest('API: GET properties', (data?.length || 0) > 0, `${data?.length} properties returned`);
+      } catch (e: any) {
+        addTest('API: GET properties', false, e.message);
+      }
+
+      // ── CRON FUNCTION TESTS ──
+
+      // 14. Health check function works
+      try {
+        const healthResult = await runHealthCheck(supabase, env);
+        addTest('CRON: health check function', healthResult.checks.length >= 5,
+          `${healthResult.checks.length} checks, ${healthResult.allPassed ? 'all passed' : healthResult.failedChecks.join(', ')}`);
+      } catch (e: any) {
+        addTest('CRON: health check function', false, e.message);
+      }
+
+      // 15. Error tracking function works
+      if (env.SARA_CACHE) {
+        try {
+          await trackError(env, 'e2e_test');
+          const hourKey = `sara_error_type:e2e_test:${new Date().toISOString().slice(0, 13).replace('T', '-')}`;
+          const count = await env.SARA_CACHE.get(hourKey);
+          // Cleanup
+          await env.SARA_CACHE.delete(hourKey);
+          addTest('CRON: error tracking', count !== null, `Tracked and read back: ${count}`);
+        } catch (e: any) {
+          addTest('CRON: error tracking', false, e.message);
+        }
+      } else {
+        addTest('CRON: error tracking', false, 'KV not configured');
+      }
+
+      // ── AI QUALITY TESTS ──
+
+      // 16. AI response mentions desarrollo
+      if (env.ANTHROPIC_API_KEY) {
+        try {
+          const claude = new ClaudeService(env.ANTHROPIC_API_KEY);
+          const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+          const calendar = new CalendarService(env.GOOGLE_SERVICE_ACCOUNT_EMAIL, env.GOOGLE_PRIVATE_KEY, env.GOOGLE_CALENDAR_ID);
+          const aiService = new AIConversationService(supabase, null, meta, calendar, claude, env);
+
+          const { data: props } = await supabase.client.from('properties').select('*');
+          const leadTest = { id: 'e2e-test', phone: '5210000099998', name: 'Test E2E', status: 'new', score: 0, notes: {} };
+          const analysis = await aiService.analyzeWithAI('hola busco casa de 3 recamaras', leadTest as any, props || []);
+          const resp = (analysis.response || '').toLowerCase();
+          const mencionaDesarrollo = resp.includes('monte verde') || resp.includes('encinos') || resp.includes('andes') ||
+            resp.includes('falco') || resp.includes('miravalle') || resp.includes('colorines');
+          addTest('AI: response mentions desarrollo', mencionaDesarrollo, analysis.response?.substring(0, 80) || 'empty');
+        } catch (e: any) {
+          addTest('AI: response mentions desarrollo', false, e.message);
+        }
+      } else {
+        addTest('AI: response mentions desarrollo', false, 'API key not configured');
+      }
+
+      // 17. AI doesn't offer rentals
+      if (env.ANTHROPIC_API_KEY) {
+        try {
+          const claude = new ClaudeService(env.ANTHROPIC_API_KEY);
+          const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+          const calendar = new CalendarService(env.GOOGLE_SERVICE_ACCOUNT_EMAIL, env.GOOGLE_PRIVATE_KEY, env.GOOGLE_CALENDAR_ID);
+          const aiService = new AIConversationService(supabase, null, meta, calendar, claude, env);
+
+          const { data: props } = await supabase.client.from('properties').select('*');
+          const leadTest = { id: 'e2e-test2', phone: '5210000099997', name: 'Test E2E2', status: 'new', score: 0, notes: {} };
+          const analysis = await aiService.analyzeWithAI('tienen casas en renta', leadTest as any, props || []);
+          const resp = (analysis.response || '').toLowerCase();
+          const noOfreceRenta = resp.includes('solo vendemos') || resp.includes('no rentamos') || resp.includes('no manejamos renta') || resp.includes('venta');
+          addTest('AI: no ofrece rentas', noOfreceRenta, analysis.response?.substring(0, 80) || 'empty');
+        } catch (e: any) {
+          addTest('AI: no ofrece rentas', false, e.message);
+        }
+      } else {
+        addTest('AI: no ofrece rentas', false, 'API key not configured');
+      }
+
+      // ── RETELL EXTENDED TESTS ──
+
+      // 18. Retell prompt has REGLA rules (via LLM API, same pattern as /test-retell-e2e)
+      if (env.RETELL_API_KEY && env.RETELL_AGENT_ID) {
+        try {
+          const { RetellService } = await import('../services/retellService');
+          const retell = new RetellService(env.RETELL_API_KEY, env.RETELL_AGENT_ID, '');
+          const agent = await retell.getAgent();
+          const llmId = agent?.response_engine?.llm_id;
+          const llm = llmId ? await retell.getLlm(llmId) : null;
+          const prompt = (llm?.general_prompt || '').toLowerCase();
+          const tieneReglas = prompt.includes('nunca pidas el celular') || prompt.includes('enviar_info_whatsapp') || prompt.includes('no rentamos');
+          addTest('Retell: prompt has rules', tieneReglas,
+            tieneReglas ? 'Key rules found in prompt' : 'No key rules in prompt');
+        } catch (e: any) {
+          addTest('Retell: prompt has rules', false, e.message);
+        }
+      } else {
+        addTest('Retell: prompt has rules', false, 'Retell not configured');
+      }
+
+      // 19. Retell tools count (via LLM API)
+      if (env.RETELL_API_KEY && env.RETELL_AGENT_ID) {
+        try {
+          const { RetellService } = await import('../services/retellService');
+          const retell = new RetellService(env.RETELL_API_KEY, env.RETELL_AGENT_ID, '');
+          const agent = await retell.getAgent();
+          const llmId = agent?.response_engine?.llm_id;
+          const llm = llmId ? await retell.getLlm(llmId) : null;
+          const toolsCount = (llm?.general_tools || []).length;
+          const toolNames = (llm?.general_tools || []).map((t: any) => t.name).join(', ');
+          addTest('Retell: tools count', toolsCount >= 3, `${toolsCount} tools: ${toolNames}`);
+        } catch (e: any) {
+          addTest('Retell: tools count', false, e.message);
+        }
+      } else {
+        addTest('Retell: tools count', false, 'Retell not configured');
+      }
+
+      // ── COMMAND DETECTION TESTS ──
+
+      // 20. CEO: detects 'leads' command
+      try {
+        const ceoService = new CEOCommandsService(supabase);
+        const detected = ceoService.detectCommand('leads');
+        addTest('Commands: CEO leads', detected !== null && detected !== undefined, `Detected: ${JSON.stringify(detected)?.substring(0, 60)}`);
+      } catch (e: any) {
+        addTest('Commands: CEO leads', false, e.message);
+      }
+
+      // 21. CEO: detects 'equipo' command
+      try {
+        const ceoService = new CEOCommandsService(supabase);
+        const detected = ceoService.detectCommand('equipo');
+        addTest('Commands: CEO equipo', detected !== null && detected !== undefined, `Detected: ${JSON.stringify(detected)?.substring(0, 60)}`);
+      } catch (e: any) {
+        addTest('Commands: CEO equipo', false, e.message);
+      }
+
+      // 22. Vendedor: detects 'citas' command
+      try {
+        const vendorService = new VendorCommandsService(supabase);
+        const detected = vendorService.detectRouteCommand('citas', 'citas');
+        addTest('Commands: Vendedor citas', detected !== null && detected !== undefined, `Detected: ${JSON.stringify(detected)?.substring(0, 60)}`);
+      } catch (e: any) {
+        addTest('Commands: Vendedor citas', false, e.message);
+      }
+
+      // 23. Vendedor: detects 'mis leads' command
+      try {
+        const vendorService = new VendorCommandsService(supabase);
+        const detected = vendorService.detectRouteCommand('mis leads', 'mis leads');
+        addTest('Commands: Vendedor mis leads', detected !== null && detected !== undefined, `Detected: ${JSON.stringify(detected)?.substring(0, 60)}`);
+      } catch (e: any) {
+        addTest('Commands: Vendedor mis leads', false, e.message);
+      }
+
+      // 24. Vendedor: detects 'cotizar' command
+      try {
+        const vendorService = new VendorCommandsService(supabase);
+        const detected = vendorService.detectRouteCommand('cotizar Roberto 2500000', 'cotizar Roberto 2500000');
+        addTest('Commands: Vendedor cotizar', detected !== null && detected !== undefined, `Detected: ${JSON.stringify(detected)?.substring(0, 60)}`);
+      } catch (e: any) {
+        addTest('Commands: Vendedor cotizar', false, e.message);
+      }
+
+      // ── TEMPLATE TESTS ──
+
+      // 25. Meta templates API accessible
+      const WABA_ID = (env as any).META_WHATSAPP_BUSINESS_ID;
+      if (WABA_ID && env.META_ACCESS_TOKEN) {
+        try {
+          const resp = await fetch(
+            `https://graph.facebook.com/v22.0/${WABA_ID}/message_templates?fields=name,status&limit=10`,
+            { headers: { 'Authorization': `Bearer ${env.META_ACCESS_TOKEN}` } }
+          );
+          if (resp.ok) {
+            const data: any = await resp.json();
+            const count = data.data?.length || 0;
+            addTest('Templates: Meta API accessible', count > 0, `${count} templates found`);
+          } else {
+            addTest('Templates: Meta API accessible', false, `Status ${resp.status}`);
+          }
+        } catch (e: any) {
+          addTest('Templates: Meta API accessible', false, e.message);
+        }
+
+        // 26. Critical templates exist
+        try {
+          const resp = await fetch(
+            `https://graph.facebook.com/v22.0/${WABA_ID}/message_templates?fields=name,status&limit=50`,
+            { headers: { 'Authorization': `Bearer ${env.META_ACCESS_TOKEN}` } }
+          );
+          if (resp.ok) {
+            const data: any = await resp.json();
+            const templates = data.data || [];
+            const required = ['resumen_vendedor', 'resumen_asesor_v2', 'reporte_vendedor', 'seguimiento_lead'];
+            const found = required.filter(r => templates.some((t: any) => t.name === r && t.status === 'APPROVED'));
+            const missing = required.filter(r => !found.includes(r));
+            addTest('Templates: critical templates exist', found.length === required.length,
+              found.length === required.length ? `All ${required.length} found APPROVED` : `Missing: ${missing.join(', ')}`);
+          } else {
+            addTest('Templates: critical templates exist', false, `Status ${resp.status}`);
+          }
+        } catch (e: any) {
+          addTest('Templates: critical templates exist', false, e.message);
+        }
+      } else {
+        addTest('Templates: Meta API accessible', false, 'WABA_ID not configured');
+        addTest('Templates: critical templates exist', false, 'WABA_ID not configured');
+      }
+
+      // ── CRON FUNCTION TESTS (extended) ──
+
+      // 27. Briefing function exists and is callable
+      try {
+        const fnType = typeof enviarBriefingMatutino;
+        addTest('CRON: briefing function', fnType === 'function', `Type: ${fnType}`);
+      } catch (e: any) {
+        addTest('CRON: briefing function', false, e.message);
+      }
+
+      // 28. Alertas function exists and is callable
+      try {
+        const fnType = typeof enviarAlertasProactivasCEO;
+        addTest('CRON: alertas CEO function', fnType === 'function', `Type: ${fnType}`);
+      } catch (e: any) {
+        addTest('CRON: alertas CEO function', false, e.message);
+      }
+
+      // ── END-TO-END TESTS ──
+
+      // 29. Properties have price_equipped
+      try {
+        const { data, error } = await supabase.client
+          .from('properties')
+          .select('id, name, price, price_equipped')
+          .not('price_equipped', 'is', null)
+          .limit(5);
+        if (error) throw error;
+        const withPrices = data?.length || 0;
+        addTest('E2E: properties have price_equipped', withPrices > 0, `${withPrices} properties with price_equipped`);
+      } catch (e: any) {
+        addTest('E2E: properties have price_equipped', false, e.message);
+      }
+
+      // 30. Team has vendedores with phones
+      try {
+        const { data, error } = await supabase.client
+          .from('team_members')
+          .select('id, name, phone, role')
+          .eq('role', 'vendedor')
+          .eq('active', true);
+        if (error) throw error;
+        const withPhone = data?.filter((t: any) => t.phone && t.phone.length > 8) || [];
+        addTest('E2E: vendedores have phones', withPhone.length >= 3,
+          `${withPhone.length} vendedores with valid phones`);
+      } catch (e: any) {
+        addTest('E2E: vendedores have phones', false, e.message);
+      }
+
+      // 31. Create appointment + delete
+      try {
+        const testLeadPhone = '5210000099998';
+        // Create test lead for appointment
+        const { data: tLead, error: tErr } = await supabase.client
+          .from('leads')
+          .insert({ phone: testLeadPhone, name: 'E2E_APPT_TEST', status: 'new', source: 'e2e_test' })
+          .select()
+          .single();
+        if (tErr) throw tErr;
+
+        const tomorrow = new Date(Date.now() + 86400000).toISOString().split('T')[0];
+        const { data: appt, error: aErr } = await supabase.client
+          .from('appointments')
+          .insert({
+            lead_id: tLead.id,
+            scheduled_date: tomorrow,
+            scheduled_time: '10:00',
+            appointment_type: 'visit',
+            status: 'scheduled',
+            property_name: 'E2E_TEST'
+          })
+          .select()
+          .single();
+        if (aErr) throw aErr;
+
+        // Cleanup
+        await supabase.client.from('appointments').delete().eq('id', appt.id);
+        await supabase.client.from('leads').delete().eq('id', tLead.id);
+
+        addTest('E2E: create + delete appointment', true, 'Appointment lifecycle OK');
+      } catch (e: any) {
+        // Cleanup
+        await supabase.client.from('leads').delete().eq('phone', '5210000099998').catch(() => {});
+        addTest('E2E: create + delete appointment', false, e.message);
+      }
+
+      // 32. Mortgage applications table accessible
+      try {
+        const { count, error } = await supabase.client
+          .from('mortgage_applications')
+          .select('*', { count: 'exact', head: true });
+        if (error) throw error;
+        addTest('E2E: mortgage_applications table', true, `${count} applications`);
+      } catch (e: any) {
+        addTest('E2E: mortgage_applications table', false, e.message);
+      }
+
+      // 33. Google Calendar API accessible
+      try {
+        const calendar = new CalendarService(env.GOOGLE_SERVICE_ACCOUNT_EMAIL, env.GOOGLE_PRIVATE_KEY, env.GOOGLE_CALENDAR_ID);
+        const hoyISO = new Date().toISOString();
+        const mananaISO = new Date(Date.now() + 86400000).toISOString();
+        const events = await calendar.getEvents(hoyISO, mananaISO, 5);
+        addTest('E2E: Google Calendar API', true, `${events?.length || 0} events today`);
+      } catch (e: any) {
+        addTest('E2E: Google Calendar API', false, e.message);
+      }
+
+      // 34. Conversation history column exists and is queryable
+      try {
+        const { data, error } = await supabase.client
+          .from('leads')
+          .select('id, conversation_history')
+          .limit(1);
+        if (error) throw error;
+        // Test passes if the column exists (query didn't error), regardless of data
+        addTest('E2E: conversation_history column', true,
+          `Column queryable, ${data?.length || 0} leads checked`);
+      } catch (e: any) {
+        addTest('E2E: conversation_history column', false, e.message);
+      }
+
+      // ── SUMMARY ──
+
+      const passed = results.filter(r => r.passed).length;
+      const failed = results.filter(r => !r.passed).length;
+      const total = results.length;
+
+      return corsResponse(JSON.stringify({
+        summary: `${passed}/${total} passed`,
+        passed,
+        failed,
+        total,
+        duration_ms: Date.now() - startTime,
+        results
+      }, null, 2));
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // API ASESOR: Endpoints para panel de asesores hipotecarios
+    // ═══════════════════════════════════════════════════════════════
+
+    // GET /api/asesor/leads?asesor_id=xxx - Ver leads del asesor
+    if (url.pathname === '/api/asesor/leads' && request.method === 'GET') {
+      const asesorId = url.searchParams.get('asesor_id');
+      if (!asesorId) {
+        return corsResponse(JSON.stringify({ error: 'Falta asesor_id' }), 400);
+      }
+
+      // Buscar leads asignados al asesor
+      const { data: allLeads } = await supabase.client
+        .from('leads')
+        .select('id, name, phone, status, created_at, notes, property_interest')
+        .not('notes', 'is', null)
+        .order('created_at', { ascending: false });
+
+      const misLeads = allLeads?.filter(l => {
+        if (!l.notes) return false;
+        const notes = typeof l.notes === 'string' ? JSON.parse(l.notes) : l.notes;
+        return notes?.credit_flow_context?.asesor_id === asesorId;
+      }).map(l => {
+        const notes = typeof l.notes === 'string' ? JSON.parse(l.notes) : l.notes;
+        const ctx = notes?.credit_flow_context || {};
+        return {
+          id: l.id,
+          name: l.name,
+          phone: l.phone,
+          status: l.status,
+          created_at: l.created_at,
+          property_interest: l.property_interest,
+          banco_preferido: ctx.banco_preferido,
+          ingreso_mensual: ctx.ingreso_mensual,
+          enganche: ctx.enganche,
+          capacidad_credito: ctx.capacidad_credito,
+          modalidad: ctx.modalidad
+        };
+      }) || [];
+
+      return corsResponse(JSON.stringify({ leads: misLeads, total: misLeads.length }));
+    }
+
+    // GET /api/asesor/lead/:id - Ver detalle de un lead
+    if (url.pathname.startsWith('/api/asesor/lead/') && request.method === 'GET') {
+      const leadId = url.pathname.split('/')[4];
+      if (!leadId) {
+        return corsResponse(JSON.stringify({ error: 'Falta lead_id' }), 400);
+      }
+
+      const { data: lead } = await supabase.client
+        .from('leads')
+        .select('*')
+        .eq('id', leadId)
+        .single();
+
+      if (!lead) {
+        return corsResponse(JSON.stringify({ error: 'Lead no encontrado' }), 404);
+      }
+
+      const notes = typeof lead.notes === 'string' ? JSON.parse(lead.notes || '{}') : (lead.notes || {});
+      const ctx = notes?.credit_flow_context || {};
+
+      return corsResponse(JSON.stringify({
+        ...lead,
+        credit_context: ctx
+      }));
+    }
+
+    // PUT /api/asesor/lead/:id - Actualizar lead
+    if (url.pathname.startsWith('/api/asesor/lead/') && request.method === 'PUT') {
+      const leadId = url.pathname.split('/')[4];
+      if (!leadId) {
+        return corsResponse(JSON.stringify({ error: 'Falta lead_id' }), 400);
+      }
+
+      const body = await request.json() as any;
+      const { status, banco_preferido, ingreso_mensual, enganche, notas_asesor } = body;
+
+      // Obtener lead actual
+      const { data: lead } = await supabase.client
+        .from('leads')
+        .select('*')
+        .eq('id', leadId)
+        .single();
+
+      if (!lead) {
+        return corsResponse(JSON.stringify({ error: 'Lead no encontrado' }), 404);
+      }
+
+      // Actualizar campos
+      const updates: any = {};
+      if (status) updates.status = status;
+
+      // Actualizar notas si hay campos de crédito
+      if (banco_preferido || ingreso_mensual || enganche || notas_asesor) {
+        const notes = typeof lead.notes === 'string' ? JSON.parse(lead.notes || '{}') : (lead.notes || {});
+        if (!notes.credit_flow_context) notes.credit_flow_context = {};
+
+        if (banco_preferido) notes.credit_flow_context.banco_preferido = banco_preferido;
+        if (ingreso_mensual) notes.credit_flow_context.ingreso_mensual = ingreso_mensual;
+        if (enganche) notes.credit_flow_context.enganche = enganche;
+        if (notas_asesor) notes.credit_flow_context.notas_asesor = notas_asesor;
+
+        updates.notes = notes;
+      }
+
+      const { error } = await supabase.client
+        .from('leads')
+        .update(updates)
+        .eq('id', leadId);
+
+      if (error) {
+        return corsResponse(JSON.stringify({ error: error.message }), 500);
+      }
+
+      return corsResponse(JSON.stringify({ ok: true, message: 'Lead actualizado' }));
+    }
+
+    // GET /api/asesor/stats?asesor_id=xxx - Estadísticas del asesor
+    if (url.pathname === '/api/asesor/stats' && request.method === 'GET') {
+      const asesorId = url.searchParams.get('asesor_id');
+      if (!asesorId) {
+        return corsResponse(JSON.stringify({ error: 'Falta asesor_id' }), 400);
+      }
+
+      const { data: allLeads } = await supabase.client
+        .from('leads')
+        .select('id, status, notes, created_at')
+        .not('notes', 'is', null);
+
+      const misLeads = allLeads?.filter(l => {
+        const notes = typeof l.notes === 'string' ? JSON.parse(l.notes) : l.notes;
+        return notes?.credit_flow_context?.asesor_id === asesorId;
+      }) || [];
+
+      const stats = {
+        total: misLeads.length,
+        por_status: {
+          new: misLeads.filter(l => l.status === 'new').length,
+          credit_qualified: misLeads.filter(l => l.status === 'credit_qualified').length,
+          contacted: misLeads.filter(l => l.status === 'contacted').length,
+          documents_pending: misLeads.filter(l => l.status === 'documents_pending').length,
+          pre_approved: misLeads.filter(l => l.status === 'pre_approved').length,
+          approved: misLeads.filter(l => l.status === 'approved').length,
+          rejected: misLeads.filter(l => l.status === 'rejected').length
+        },
+        conversion_rate: misLeads.length > 0
+          ? Math.round((misLeads.filter(l => l.status === 'approved').length / misLeads.length) * 100)
+          : 0,
+        este_mes: misLeads.filter(l => {
+          const created = new Date(l.created_at);
+          const now = new Date();
+          return created.getMonth() === now.getMonth() && created.getFullYear() === now.getFullYear();
+        }).length
+      };
+
+      return corsResponse(JSON.stringify(stats));
+    }
+
+    // POST /api/asesor/mensaje - Enviar mensaje a lead vía Sara
+    if (url.pathname === '/api/asesor/mensaje' && request.method === 'POST') {
+      const body = await request.json() as any;
+      const { asesor_id, lead_id, mensaje } = body;
+
+      if (!asesor_id || !lead_id || !mensaje) {
+        return corsResponse(JSON.stringify({ error: 'Faltan campos: asesor_id, lead_id, mensaje' }), 400);
+      }
+
+      // Obtener asesor
+      const { data: asesor } = await supabase.client
+        .from('team_members')
+        .select('name')
+        .eq('id', asesor_id)
+        .single();
+
+      // Obtener lead
+      const { data: lead } = await supabase.client
+        .from('leads')
+        .select('name, phone')
+        .eq('id', lead_id)
+        .single();
+
+      if (!lead) {
+        return corsResponse(JSON.stringify({ error: 'Lead no encontrado' }), 404);
+      }
+
+      const nombreAsesor = asesor?.name?.split(' ')[0] || 'Tu asesor';
+      const mensajeParaLead = `💬 *Mensaje de tu asesor ${nombreAsesor}:*\n\n"${mensaje}"\n\n_Puedes responder aquí y le haré llegar tu mensaje._`;
+
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+      await meta.sendWhatsAppMessage(lead.phone.replace(/\D/g, ''), mensajeParaLead);
+
+      return corsResponse(JSON.stringify({ ok: true, message: 'Mensaje enviado' }));
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // FIX: Agregar cita existente a Google Calendar
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/fix-cita-calendar') {
+      const leadName = url.searchParams.get('lead_name');
+      if (!leadName) {
+        return corsResponse(JSON.stringify({ error: 'Falta lead_name' }), 400);
+      }
+
+      // Buscar la cita
+      const { data: cita, error: citaError } = await supabase.client
+        .from('appointments')
+        .select('*, leads(name, phone)')
+        .eq('lead_name', leadName)
+        .is('google_event_vendedor_id', null)
+        .order('created_at', { ascending: false })
+        .limit(1)
+        .single();
+
+      if (citaError || !cita) {
+        return corsResponse(JSON.stringify({ error: 'Cita no encontrada', details: citaError?.message }), 404);
+      }
+
+      // Crear evento en Google Calendar
+      const fechaEvento = new Date(`${cita.scheduled_date}T${cita.scheduled_time}`);
+      const endEvento = new Date(fechaEvento.getTime() + 60 * 60 * 1000);
+
+      const formatDate = (d: Date) => {
+        const year = d.getFullYear();
+        const month = String(d.getMonth() + 1).padStart(2, '0');
+        const day = String(d.getDate()).padStart(2, '0');
+        const hours = String(d.getHours()).padStart(2, '0');
+        const minutes = String(d.getMinutes()).padStart(2, '0');
+        return `${year}-${month}-${day}T${hours}:${minutes}:00`;
+      };
+
+      try {
+        // Crear instancia local de CalendarService
+        const calendarLocal = new CalendarService(
+          env.GOOGLE_SERVICE_ACCOUNT_EMAIL,
+          env.GOOGLE_PRIVATE_KEY,
+          env.GOOGLE_CALENDAR_ID
+        );
+
+        const eventData = {
+          summary: `🏠 Visita - ${cita.lead_name} (${cita.property_name || 'Desarrollo'})`,
+          description: `👤 Cliente: ${cita.lead_name}\n📱 Tel: ${cita.lead_phone || 'N/A'}\n🏠 Desarrollo: ${cita.property_name || 'Por definir'}`,
+          location: cita.location || cita.property_name || '',
+          start: { dateTime: formatDate(fechaEvento), timeZone: 'America/Mexico_City' },
+          end: { dateTime: formatDate(endEvento), timeZone: 'America/Mexico_City' }
+        };
+
+        const eventResult = await calendarLocal.createEvent(eventData);
+
+        // Actualizar la cita con el google_event_vendedor_id
+        await supabase.client
+          .from('appointments')
+          .update({ google_event_vendedor_id: eventResult.id })
+          .eq('id', cita.id);
+
+        return corsResponse(JSON.stringify({
+          ok: true,
+          message: `Cita de ${cita.lead_name} agregada a Google Calendar`,
+          google_event_id: eventResult.id,
+          cita_id: cita.id
+        }));
+      } catch (calError: any) {
+        return corsResponse(JSON.stringify({ error: 'Error creando evento', details: calError?.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // UPDATE PROPERTY - Actualizar campo de una propiedad
+    // USO: /update-property?id=XXX&field=gps_link&value=https://...&api_key=XXX
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/update-property') {
+      const propId = url.searchParams.get('id');
+      const field = url.searchParams.get('field');
+      const value = url.searchParams.get('value');
+      if (!propId || !field || !value) return corsResponse(JSON.stringify({ error: 'Falta id, field o value' }), 400);
+      const allowed = ['gps_link', 'photo_url', 'youtube_link', 'price_equipped', 'price', 'description'];
+      if (!allowed.includes(field)) return corsResponse(JSON.stringify({ error: `Campo no permitido. Usar: ${allowed.join(', ')}` }), 400);
+      const { error } = await supabase.client.from('properties').update({ [field]: value }).eq('id', propId);
+      if (error) return corsResponse(JSON.stringify({ error: error.message }), 500);
+      await getEntityCache(supabase, env.SARA_CACHE).invalidate('properties');
+      const { data: updated } = await supabase.client.from('properties').select('name, ' + field).eq('id', propId).single();
+
+      // Si se actualizó precio, re-sync Retell automáticamente
+      let retellSync: any = null;
+      if ((field === 'price' || field === 'price_equipped') && env.RETELL_API_KEY) {
+        try {
+          const syncResp = await fetch(
+            `https://sara-backend.edson-633.workers.dev/configure-retell-tools?api_key=${env.API_SECRET}`
+          );
+          retellSync = { ok: syncResp.ok, status: syncResp.status };
+          console.log(`🤖 Retell auto-sync after price update: ${syncResp.ok ? '✅' : '❌'}`);
+        } catch (e: any) {
+          retellSync = { ok: false, error: e.message };
+          console.error('⚠️ Retell auto-sync failed:', e.message);
+        }
+      }
+
+      return corsResponse(JSON.stringify({ ok: true, updated, retell_sync: retellSync }));
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // CHECK FACEBOOK LEADS - Verificar suscripción de Facebook Lead Ads
+    // USO: /check-fb-leads?api_key=XXX
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/check-fb-leads') {
+      const token = env.META_ACCESS_TOKEN;
+      const results: any = {};
+
+      // 1. Check app subscriptions
+      try {
+        const appResp = await fetch(`https://graph.facebook.com/v21.0/1552990676007903/subscriptions?access_token=${token}`);
+        const appData: any = await appResp.json();
+        results.app_subscriptions = appData.data || appData;
+      } catch (e: any) { results.app_subscriptions_error = e.message; }
+
+      // 2. Get WABA ID and check for pages
+      try {
+        const wabaResp = await fetch(`https://graph.facebook.com/v21.0/${env.META_WHATSAPP_BUSINESS_ID}?fields=name,id&access_token=${token}`);
+        const wabaData: any = await wabaResp.json();
+        results.whatsapp_business = wabaData;
+      } catch (e: any) { results.waba_error = e.message; }
+
+      // 3. Try to get pages associated with the business
+      try {
+        const bizResp = await fetch(`https://graph.facebook.com/v21.0/me/accounts?access_token=${token}`);
+        const bizData: any = await bizResp.json();
+        results.pages = bizData.data || bizData;
+
+        // 4. For each page, check leadgen subscriptions
+        if (Array.isArray(results.pages)) {
+          for (const page of results.pages) {
+            try {
+              const subResp = await fetch(`https://graph.facebook.com/v21.0/${page.id}/subscribed_apps?access_token=${page.access_token || token}`);
+              const subData: any = await subResp.json();
+              page.subscribed_apps = subData.data || subData;
+            } catch (e: any) { page.subscription_error = e.message; }
+          }
+        }
+      } catch (e: any) { results.pages_error = e.message; }
+
+      // 5. Check webhook config on the WhatsApp side
+      results.webhook_url_expected = 'https://sara-backend.edson-633.workers.dev/webhook/facebook-leads';
+      results.webhook_verify_token = 'sara_fb_leads_token';
+
+      // 6. Check scopes
+      try {
+        const debugResp = await fetch(`https://graph.facebook.com/v21.0/debug_token?input_token=${token}&access_token=${token}`);
+        const debugData: any = await debugResp.json();
+        const scopes = debugData.data?.scopes || [];
+        results.token_scopes = scopes;
+        results.has_leads_retrieval = scopes.includes('leads_retrieval');
+        results.has_pages_manage = scopes.includes('pages_manage_metadata');
+        results.has_pages_read = scopes.includes('pages_read_engagement') || scopes.includes('pages_show_list');
+      } catch (e: any) { results.scopes_error = e.message; }
+
+      return corsResponse(JSON.stringify(results, null, 2));
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // CHECK TOKEN - Verificar tipo y expiración del token de Meta
+    // USO: /check-token?api_key=XXX
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/check-token') {
+      const token = env.META_ACCESS_TOKEN;
+      const tokenPrefix = token?.substring(0, 10) || 'N/A';
+      const tokenLength = token?.length || 0;
+
+      // Debug token via Meta API
+      let tokenInfo: any = { error: 'No se pudo verificar' };
+      try {
+        const debugResp = await fetch(
+          `https://graph.facebook.com/v21.0/debug_token?input_token=${token}&access_token=${token}`
+        );
+        const debugData: any = await debugResp.json();
+        if (debugData.data) {
+          const d = debugData.data;
+          tokenInfo = {
+            app_id: d.app_id,
+            type: d.type, // USER, PAGE, APP, SYSTEM
+            expires_at: d.expires_at === 0 ? 'NEVER (permanent)' : new Date(d.expires_at * 1000).toISOString(),
+            is_valid: d.is_valid,
+            scopes: d.scopes,
+            granular_scopes: d.granular_scopes?.map((s: any) => s.permission),
+            issued_at: d.issued_at ? new Date(d.issued_at * 1000).toISOString() : null,
+            profile_id: d.profile_id,
+            user_id: d.user_id,
+          };
+        } else {
+          tokenInfo = { error: debugData.error?.message || 'Unknown error', raw: debugData };
+        }
+      } catch (e: any) {
+        tokenInfo = { error: e.message };
+      }
+
+      return corsResponse(JSON.stringify({
+        ok: true,
+        token_prefix: tokenPrefix + '...',
+        token_length: tokenLength,
+        is_system_user: tokenInfo.type === 'SYSTEM',
+        permanent: tokenInfo.expires_at === 'NEVER (permanent)',
+        token_info: tokenInfo,
+        recommendation: tokenInfo.type === 'SYSTEM'
+          ? '✅ Token de System User - permanente, ideal para producción'
+          : tokenInfo.type === 'USER'
+            ? '⚠️ Token de usuario - EXPIRA. Cambiar a System User en business.facebook.com/settings/system-users'
+            : `ℹ️ Token tipo: ${tokenInfo.type || 'desconocido'}`
+      }, null, 2));
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // ONBOARDING - Enviar mensaje de bienvenida al equipo
+    // USO: /onboarding-equipo?api_key=XXX (dry-run)
+    // USO: /onboarding-equipo?enviar=true&api_key=XXX (envío real)
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/onboarding-equipo') {
+      const enviar = url.searchParams.get('enviar') === 'true';
+      const soloPhone = url.searchParams.get('phone');
+      const meta = new MetaWhatsAppService(env.META_PHONE_NUMBER_ID, env.META_ACCESS_TOKEN);
+
+      let query = supabase.client
+        .from('team_members')
+        .select('id, name, phone, role, active')
+        .eq('active', true)
+        .order('role');
+
+      if (soloPhone) {
+        query = supabase.client
+          .from('team_members')
+          .select('id, name, phone, role, active')
+          .or(`phone.eq.${soloPhone},phone.like.%${soloPhone.slice(-10)}`);
+      }
+
+      const { data: members } = await query;
+
+      if ((!members || members.length === 0) && soloPhone) {
+        // Phone not in team_members - send directly
+        try {
+          await meta.sendTemplate(soloPhone, 'reactivar_equipo', 'es_MX', [
+            { type: 'body', parameters: [{ type: 'text', text: 'Hola' }] }
+          ], true);
+          return corsResponse(JSON.stringify({ ok: true, mode: 'ENVÍO DIRECTO', phone: soloPhone, status: '✅ Template enviado (no es team member)' }));
+        } catch (e: any) {
+          return corsResponse(JSON.stringify({ error: e.message }), 500);
+        }
+      }
+      if (!members || members.length === 0) {
+        return corsResponse(JSON.stringify({ error: 'No hay team members activos' }), 400);
+      }
+
+      const results: any[] = [];
+
+      for (const m of members) {
+        const roleName = m.role === 'admin' ? 'CEO'
+          : m.role === 'vendedor' ? 'Vendedor'
+          : m.role === 'coordinador' ? 'Coordinador'
+          : m.role === 'asesor' ? 'Asesor'
+          : m.role;
+
+        if (enviar) {
+          try {
+            // Send template reactivar_equipo (doesn't need 24h window)
+            await meta.sendTemplate(m.phone, 'reactivar_equipo', 'es_MX', [
+              { type: 'body', parameters: [{ type: 'text', text: m.name?.split(' ')[0] || 'Hola' }] }
+            ], true);
+            results.push({ name: m.name, phone: m.phone, role: roleName, status: '✅ Template enviado' });
+          } catch (e: any) {
+            results.push({ name: m.name, phone: m.phone, role: roleName, status: `❌ Error: ${e.message}` });
+          }
+        } else {
+          results.push({ name: m.name, phone: m.phone, role: roleName, status: '🔍 Dry-run (sin enviar)' });
+        }
+      }
+
+      return corsResponse(JSON.stringify({
+        ok: true,
+        mode: enviar ? 'ENVÍO REAL' : 'DRY-RUN (agregar ?enviar=true para enviar)',
+        total: results.length,
+        results
+      }, null, 2));
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // ACTIVATE TEAM MEMBERS - Activar/desactivar miembros
+    // USO: /activate-team?exclude=Vendedor Test,Asesor Crédito Test&api_key=XXX
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/activate-team') {
+      const exclude = (url.searchParams.get('exclude') || '').split(',').map(s => s.trim()).filter(Boolean);
+      // Activate all
+      const { error: e1 } = await supabase.client.from('team_members').update({ active: true }).neq('name', '');
+      if (e1) return corsResponse(JSON.stringify({ error: e1.message }), 500);
+      // Deactivate excluded
+      for (const name of exclude) {
+        await supabase.client.from('team_members').update({ active: false }).eq('name', name);
+      }
+      await getEntityCache(supabase, env.SARA_CACHE).invalidate('team');
+      // Verify
+      const { data } = await supabase.client.from('team_members').select('name, active, role').order('role');
+      const activeM = (data || []).filter((m: any) => m.active);
+      const inactiveM = (data || []).filter((m: any) => !m.active);
+      return corsResponse(JSON.stringify({ ok: true, active: activeM.length, inactive: inactiveM.length, activeMembers: activeM, inactiveMembers: inactiveM }));
+    }
+
+    if (url.pathname === '/check-template') {
+      const WABA_ID = (env as any).META_WHATSAPP_BUSINESS_ID;
+      const tplName = url.searchParams.get('name') || 'alerta_sistema';
+      if (!WABA_ID) return corsResponse(JSON.stringify({ error: 'WABA_ID not configured' }), 400);
+      try {
+        const resp = await fetch(
+          `https://graph.facebook.com/v22.0/${WABA_ID}/message_templates?name=${tplName}&fields=name,status,category,language`,
+          { headers: { 'Authorization': `Bearer ${env.META_ACCESS_TOKEN}` } }
+        );
+        const result: any = await resp.json();
+        return corsResponse(JSON.stringify({ ok: resp.ok, templates: result.data || [], raw: result }));
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════════
+    // CREAR TEMPLATE alerta_sistema en Meta (ejecutar una sola vez)
+    // USO: /crear-template-alerta?api_key=XXX
+    // ═══════════════════════════════════════════════════════════════
+    if (url.pathname === '/crear-template-alerta') {
+      const WABA_ID = (env as any).META_WHATSAPP_BUSINESS_ID;
+      if (!WABA_ID) {
+        return corsResponse(JSON.stringify({ error: 'META_WHATSAPP_BUSINESS_ID no configurado' }), 400);
+      }
+      try {
+        const resp = await fetch(
+          `https://graph.facebook.com/v22.0/${WABA_ID}/message_templates`,
+          {
+            method: 'POST',
+            headers: {
+              'Authorization': `Bearer ${env.META_ACCESS_TOKEN}`,
+              'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+              name: 'alerta_sistema',
+              language: 'es_MX',
+              category: 'UTILITY',
+              components: [
+                {
+                  type: 'BODY',
+                  text: '🚨 *Alerta Sistema SARA*\n\n{{1}}\n\n_Alerta automática_',
+                  example: { body_text: [['Health check: Base de datos no responde. Verificar Supabase.']] }
+                }
+              ]
+            })
+          }
+        );
+        const result: any = await resp.json();
+        return corsResponse(JSON.stringify({
+          ok: resp.ok,
+          status: resp.status,
+          result,
+          nota: resp.ok ? 'Template creado. Esperar aprobación de Meta (usualmente minutos para UTILITY).' : 'Error al crear template'
+        }));
+      } catch (e: any) {
+        return corsResponse(JSON.stringify({ error: e.message }), 500);
+      }
+    }
+
+    // ═══════════════════════════════════════════════════════════
+    // Create Carousel Templates in Meta Business Manager
+    // Usage: /create-carousel-templates?api_key=XXX&template=all
+    // Options: template=casas_economicas|casas_premium|terrenos_nogal|all
+    //          action=delete (delete templates first, then recreate)
+    // TEMPORARY - Remove after templates are approved
+    // ═══════════════════════════════════════════════════════════
+    if (url.pathname === '/create-carousel-templates' && request.method === 'GET') {
+      const templateParam = url.searchParams.get('template') || 'all';
+      const actionParam = url.searchParams.get('action') || 'create';
+      const WABA_ID = '1227849769248437';
+
+      // If action=status, just query template status from Meta
+      if (actionParam === 'status') {
+        const namesToCheck = templateParam === 'all'
+          ? ['casas_economicas_v2', 'casas_premium_v2', 'terrenos_nogal', 'casas_guadalupe', 'casas_zacatecas', 'casas_2_recamaras', 'casas_3_recamaras', 'casas_con_credito']
+          : [templateParam];
+        const statusResults: any[] = [];
+        for (const tplName of namesToCheck) {
+          try {
+            const resp = await fetch(
+              `https://graph.facebook.com/v22.0/${WABA_ID}/message_templates?name=${tplName}`,
+              { headers: { 'Authorization': `Bearer ${env.META_ACCESS_TOKEN}` } }
+            );
+            const data: any = await resp.json();
+            const tpl = data?.data?.[0];
+            statusResults.push({
+              template: tplName,
+              status: tpl?.status || 'NOT_FOUND',
+              id: tpl?.id || null,
+              category: tpl?.category || null,
+            });
+          } catch (err: any) {
+            statusResults.push({ template: tplName, error: err.message });
+          }
+        }
+        return corsResponse(JSON.stringify({ action: 'status', results: statusResults }, null, 2));
+      }
+
+      // If action=delete, delete templates first
+      if (actionParam === 'delete' || actionParam === 'recreate') {
+        const templatesToDelete = templateParam === 'all'
+          ? ['casas_economicas', 'casas_premium', 'casas_economicas_v2', 'casas_premium_v2', 'terrenos_nogal', 'casas_guadalupe', 'casas_zacatecas', 'casas_2_recamaras', 'casas_3_recamaras', 'casas_con_credito']
+          : [templateParam];
+        const deleteResults: any[] = [];
+        for (const tplName of templatesToDelete) {
+          try {
+            const delResp = await fetch(
+              `https://graph.facebook.com/v22.0/${WABA_ID}/message_templates?name=${tplName}`,
+              {
+                method: 'DELETE',
+                headers: { 'Authorization': `Bearer ${env.META_ACCESS_TOKEN}` }
+              }
+            );
+            const delData: any = await delResp.json();
+            deleteResults.push({ template: tplName, status: delResp.status, success: delData.success, data: delData });
+            console.log(`🗑️ Delete ${tplName}: ${delResp.status} - ${JSON.stringify(delData)}`);
+          } catch (err: any) {
+            deleteResults.push({ template: tplName, error: err.message });
+          }
+        }
+        if (actionParam === 'delete') {
+          return corsResponse(JSON.stringify({ action: 'delete', results: deleteResults }, null, 2));
+        }
+        // If recreate, continue to creation below after a short delay
+        await new Promise(r => setTimeout(r, 2000));
+        console.log('⏳ Waiting 2s after delete before recreating...');
+      }
+
+      // Image URLs per development
+      const FOTOS: Record<string, string> = {
+        'Monte Verde': 'https://gruposantarita.com.mx/wp-content/uploads/2024/11/MONTE-VERDE-FACHADA-DESARROLLO-EDIT-scaled.jpg',
+        'Los Encinos': 'https://gruposantarita.com.mx/wp-content/uploads/2020/09/Encinos-Amenidades-1.jpg',
+        'Andes': 'https://gruposantarita.com.mx/wp-content/uploads/2022/09/Dalia_act.jpg',
+        'Miravalle': 'https://gruposantarita.com.mx/wp-content/uploads/2024/10/BILBAO-FACHADA-scaled.jpg',
+        'Distrito Falco': 'https://gruposantarita.com.mx/wp-content/uploads/2020/09/img01-5.jpg',
+        'Paseo Colorines': 'https://gruposantarita.com.mx/wp-content/uploads/2024/11/MONTE-VERDE-FACHADA-DESARROLLO-EDIT-scaled.jpg',
+        'Alpes': 'https://gruposantarita.com.mx/wp-content/uploads/2020/09/Alpes-Amenidades-1.jpg',
+        'Villa Campelo': 'https://gruposantarita.com.mx/wp-content/uploads/2023/10/RF_Casa-Club-1.jpg',
+        'Villa Galiano': 'https://gruposantarita.com.mx/wp-content/uploads/2025/02/VILLA-GALIANO-ACCESO-2560-X-2560-PX@2x-scaled.jpg',
+      };
+
+      // Step 1: Get app_id from debug_token
+      let appId: string;
+      try {
+        const debugUrl = `https://graph.facebook.com/debug_token?input_token=${env.META_ACCESS_TOKEN}&access_token=${env.META_ACCESS_TOKEN}`;
+        const debugResp = await fetch(debugUrl);
+        const debugData: any = await debugResp.json();
+        appId = debugData?.data?.app_id;
+        if (!appId) {
+          return corsResponse(JSON.stringify({ error: 'Could not get app_id', debugData }, null, 2), 500);
+        }
+        console.log(`✅ Got app_id: ${appId}`);
+      } catch (err: any) {
+        return corsResponse(JSON.stringify({ error: `debug_token failed: ${err.message}` }), 500);
+      }
+
+      // Helper: Upload image to Meta Resumable Upload API → get header_handle
+      async function uploadImageToMeta(imageUrl: string, fileName: string): Promise<string> {
+        // 1. Fetch image from URL
+        const imgResp = await fetch(imageUrl);
+        if (!imgResp.ok) throw new Error(`Failed to fetch image ${imageUrl}: ${imgResp.status}`);
+        const imgBuffer = await imgResp.arrayBuffer();
+        const imgType = imgResp.headers.get('content-type') || 'image/jpeg';
+        console.log(`📥 Downloaded ${fileName}: ${imgBuffer.byteLength} bytes (${imgType})`);
+
+        // 2. Create upload session
+        const sessionResp = await fetch(`https://graph.facebook.com/v22.0/${appId}/uploads`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${env.META_ACCESS_TOKEN}`,
+            'Content-Type': 'application/x-www-form-urlencoded'
+          },
+          body: new URLSearchParams({
+            file_length: String(imgBuffer.byteLength),
+            file_type: imgType.split(';')[0], // strip charset if any
+            file_name: fileName
+          })
+        });
+        const sessionData: any = await sessionResp.json();
+        if (!sessionData.id) throw new Error(`Upload session failed: ${JSON.stringify(sessionData)}`);
+        console.log(`📤 Upload session: ${sessionData.id}`);
+
+        // 3. Upload file data
+        const uploadResp = await fetch(`https://graph.facebook.com/v22.0/${sessionData.id}`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `OAuth ${env.META_ACCESS_TOKEN}`,
+            'file_offset': '0',
+            'Content-Type': imgType.split(';')[0]
+          },
+          body: imgBuffer
+        });
+        const uploadData: any = await uploadResp.json();
+        if (!uploadData.h) throw new Error(`Upload data failed: ${JSON.stringify(uploadData)}`);
+        console.log(`✅ Got header_handle for ${fileName}`);
+
+        return uploadData.h;
+      }
+
+      // Template definitions — 2 params per card to pass Meta's param-to-text ratio
+      const TEMPLATE_DEFS: Record<string, {
+        developments: string[];
+        bodyText: string;
+        bodyExample: string[][] | null;
+        cardBody: string;
+        cardExamples: string[][];
+      }> = {
+        casas_economicas_v2: {
+          developments: ['Monte Verde', 'Andes', 'Alpes'],
+          bodyText: 'Conoce nuestras casas desde {{1}} en Zacatecas y Guadalupe 🏠',
+          bodyExample: [['$1.6M']],
+          cardBody: '🏠 {{1}}\n💰 Casas desde {{2}} equipadas con cocina y closets',
+          cardExamples: [
+            ['Monte Verde - 2 a 3 recámaras en Colinas del Padre', '$1.6M'],
+            ['Priv. Andes - 2 a 3 recámaras en Guadalupe', '$1.6M'],
+            ['Alpes - 2 a 3 recámaras en Colinas del Padre', '$1.6M'],
+          ]
+        },
+        casas_premium_v2: {
+          developments: ['Los Encinos', 'Miravalle', 'Paseo Colorines', 'Distrito Falco'],
+          bodyText: 'Conoce nuestras casas premium desde {{1}} en Zacatecas y Guadalupe 🏠',
+          bodyExample: [['$3.0M']],
+          cardBody: '🏠 {{1}}\n💰 Casas desde {{2}} equipadas con cocina y closets',
+          cardExamples: [
+            ['Los Encinos - 3 recámaras en Colinas del Padre', '$3.0M'],
+            ['Miravalle - 3 recámaras en Colinas del Padre', '$3.0M'],
+            ['Paseo Colorines - 3 recámaras en Colinas del Padre', '$3.0M'],
+            ['Distrito Falco - 3 recámaras en Guadalupe', '$3.7M'],
+          ]
+        },
+        terrenos_nogal: {
+          developments: ['Villa Campelo', 'Villa Galiano'],
+          bodyText: 'Invierte en terrenos residenciales en Citadella del Nogal, Guadalupe 🏗',
+          bodyExample: null,
+          cardBody: '🏗 {{1}}\n💰 Terrenos residenciales desde {{2}} por metro cuadrado',
+          cardExamples: [
+            ['Villa Campelo - Citadella del Nogal', '$8,500'],
+            ['Villa Galiano - Citadella del Nogal', '$6,400'],
+          ]
+        },
+        casas_guadalupe: {
+          developments: ['Andes', 'Distrito Falco', 'Alpes'],
+          bodyText: 'Conoce nuestras casas en Guadalupe desde {{1}} 🏠',
+          bodyExample: [['$1.6M']],
+          cardBody: '🏠 {{1}}\n💰 Casas desde {{2}} equipadas con cocina y closets',
+          cardExamples: [
+            ['Priv. Andes - 2 a 3 recámaras en Guadalupe', '$1.6M'],
+            ['Distrito Falco - 3 recámaras en Guadalupe', '$3.7M'],
+            ['Alpes - 2 recámaras en Guadalupe', '$2.0M'],
+          ]
+        },
+        casas_zacatecas: {
+          developments: ['Monte Verde', 'Los Encinos', 'Miravalle', 'Paseo Colorines'],
+          bodyText: 'Conoce nuestras casas en Zacatecas desde {{1}} 🏠',
+          bodyExample: [['$1.6M']],
+          cardBody: '🏠 {{1}}\n💰 Casas desde {{2}} equipadas con cocina y closets',
+          cardExamples: [
+            ['Monte Verde - 2 a 3 recámaras en Colinas del Padre', '$1.6M'],
+            ['Los Encinos - 3 recámaras en Colinas del Padre', '$3.0M'],
+            ['Miravalle - 3 recámaras en Colinas del Padre', '$3.0M'],
+            ['Paseo Colorines - 3 recámaras en Colinas del Padre', '$3.0M'],
+          ]
+        },
+        casas_2_recamaras: {
+          developments: ['Monte Verde', 'Andes', 'Alpes', 'Miravalle', 'Distrito Falco'],
+          bodyText: 'Casas de 2 recámaras desde {{1}} en Zacatecas y Guadalupe 🏠',
+          bodyExample: [['$1.6M']],
+          cardBody: '🏠 {{1}}\n💰 Casas de 2 rec desde {{2}} equipadas con cocina y closets',
+          cardExamples: [
+            ['Monte Verde - 2 recámaras en Colinas del Padre', '$1.6M'],
+            ['Priv. Andes - 2 recámaras en Guadalupe (con alberca)', '$1.6M'],
+            ['Alpes - 2 recámaras en Guadalupe', '$2.0M'],
+            ['Miravalle - 2 recámaras en Colinas del Padre', '$3.0M'],
+            ['Distrito Falco - 2 recámaras en Guadalupe', '$3.7M'],
+          ]
+        },
+        casas_3_recamaras: {
+          developments: ['Monte Verde', 'Andes', 'Los Encinos', 'Miravalle', 'Paseo Colorines', 'Distrito Falco'],
+          bodyText: 'Casas de 3 recámaras desde {{1}} en Zacatecas y Guadalupe 🏠',
+          bodyExample: [['$2.2M']],
+          cardBody: '🏠 {{1}}\n💰 Casas de 3 rec desde {{2}} equipadas con cocina y closets',
+          cardExamples: [
+            ['Monte Verde - 3 recámaras en Colinas del Padre', '$2.2M'],
+            ['Priv. Andes - 3 recámaras en Guadalupe (con alberca)', '$2.3M'],
+            ['Los Encinos - 3 recámaras en Colinas del Padre', '$3.0M'],
+            ['Miravalle - 3 recámaras en Colinas del Padre', '$3.5M'],
+            ['Paseo Colorines - 3 recámaras en Colinas del Padre', '$3.2M'],
+            ['Distrito Falco - 3 recámaras en Guadalupe', '$4.0M'],
+          ]
+        },
+        casas_con_credito: {
+          developments: ['Monte Verde', 'Andes', 'Alpes', 'Miravalle'],
+          bodyText: 'Casas con crédito bancario, Infonavit y Fovissste desde {{1}} 🏦',
+          bodyExample: [['$1.6M']],
+          cardBody: '🏠 {{1}}\n💰 Desde {{2}} — Crédito bancario, Infonavit y Fovissste',
+          cardExamples: [
+            ['Monte Verde - 2 a 3 rec en Colinas del Padre', '$1.6M'],
+            ['Priv. Andes - 2 a 3 rec en Guadalupe (con alberca)', '$1.6M'],
+            ['Alpes - 2 rec en Guadalupe', '$2.0M'],
+            ['Miravalle - 2 a 3 rec en Colinas del Padre', '$3.0M'],
+          ]
+        }
+      };
+
+      const templatesToCreate = templateParam === 'all'
+        ? Object.keys(TEMPLATE_DEFS)
+        : [templateParam];
+
+      const results: any[] = [];
+
+      for (const tplName of templatesToCreate) {
+        const tpl = TEMPLATE_DEFS[tplName];
+        if (!tpl) {
+          results.push({ template: tplName, error: 'Template definition not found' });
+          continue;
+        }
+
+        try {
+          // Upload images for each card
+          const handles: string[] = [];
+          for (let i = 0; i < tpl.developments.length; i++) {
+            const dev = tpl.developments[i];
+            const imageUrl = FOTOS[dev] || FOTOS['Monte Verde'];
+            console.log(`📤 [${tplName}] Uploading image for ${dev}...`);
+            const handle = await uploadImageToMeta(imageUrl, `${tplName}_card${i + 1}.jpg`);
+            handles.push(handle);
+          }
+
+          // Build carousel cards
+          const cards = tpl.developments.map((dev: string, i: number) => ({
+            components: [
+              {
+                type: 'HEADER',
+                format: 'IMAGE',
+                example: { header_handle: [handles[i]] }
+              },
+              {
+                type: 'BODY',
+                text: tpl.cardBody,
+                example: { body_text: [tpl.cardExamples[i]] }
+              },
+              {
+                type: 'BUTTONS',
+                buttons: [
+                  { type: 'QUICK_REPLY', text: 'Ver mas' },
+                  { type: 'QUICK_REPLY', text: 'Agendar visita' }
+                ]
+              }
+            ]
+          }));
+
+          // Build full template payload
+          const components: any[] = [];
+
+          // Bubble body (above cards)
+          const bodyComponent: any = { type: 'BODY', text: tpl.bodyText };
+          if (tpl.bodyExample) {
+            bodyComponent.example = { body_text: tpl.bodyExample };
+          }
+          components.push(bodyComponent);
+
+          // Carousel component
+          components.push({ type: 'CAROUSEL', cards });
+
+          const payload = {
+            name: tplName,
+            language: 'es_MX',
+            category: 'MARKETING',
+            components
+          };
+
+          // Create template via Meta API
+          const createUrl = `https://graph.facebook.com/v22.0/${WABA_ID}/message_templates`;
+          const resp = await fetch(createUrl, {
+            method: 'POST',
+            headers: {
+              'Authorization': `Bearer ${env.META_ACCESS_TOKEN}`,
+              'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(payload)
+          });
+
+          const result: any = await resp.json();
+          results.push({
+            template: tplName,
+            success: resp.ok,
+            status: resp.status,
+            cards_count: tpl.developments.length,
+            developments: tpl.developments,
+            result
+          });
+
+          console.log(`${resp.ok ? '✅' : '❌'} Template ${tplName}: ${resp.status} - ${JSON.stringify(result)}`);
+        } catch (error: any) {
+          results.push({ template: tplName, error: error.message });
+          console.error(`❌ Template ${tplName} failed:`, error.message);
+        }
+      }
+
+      return corsResponse(JSON.stringify({
+        app_id: appId,
+        waba_id: WABA_ID,
+        templates_requested: templatesToCreate,
+        results
+      }, null, 2));
+    }
+
+    return null; // Not an ops route
+}
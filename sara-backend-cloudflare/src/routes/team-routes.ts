@@ -1,4 +1,5 @@
 import { SupabaseService } from '../services/supabase';
+import { getEntityCache } from '../services/entityCache';
 import { isAllowedCrmOrigin, getCorsHeaders, parsePagination, paginatedResponse, validateRequired, validatePhone, validateRole } from './cors';
 
 function checkTeamAuth(request: Request, env: any): boolean {
@@ -95,10 +96,8 @@ export async function handleTeamRoutes(request: Request, env: any, supabase: Sup
       });
     }
 
-    // Invalidate team_members cache
-    if (env.SARA_CACHE) {
-      try { await env.SARA_CACHE.delete('team_members:all'); } catch (_) {}
-    }
+    // Invalidate team_members cache (scope + isolate + KV)
+    await getEntityCache(supabase, env.SARA_CACHE).invalidate('team');
 
     return new Response(JSON.stringify(data), {
       status: 201,
@@ -153,10 +152,8 @@ export async function handleTeamRoutes(request: Request, env: any, supabase: Sup
       });
     }
 
-    // Invalidate team_members cache
-    if (env.SARA_CACHE) {
-      try { await env.SARA_CACHE.delete('team_members:all'); } catch (_) {}
-    }
+    // Invalidate team_members cache (scope + isolate + KV)
+    await getEntityCache(supabase, env.SARA_CACHE).invalidate('team');
 
     return new Response(JSON.stringify(data), {
       headers: { ...corsHeaders, 'Content-Type': 'application/json' }
@@ -178,10 +175,8 @@ export async function handleTeamRoutes(request: Request, env: any, supabase: Sup
       });
     }
 
-    // Invalidate team_members cache
-    if (env.SARA_CACHE) {
-      try { await env.SARA_CACHE.delete('team_members:all'); } catch (_) {}
-    }
+    // Invalidate team_members cache (scope + isolate + KV)
+    await getEntityCache(supabase, env.SARA_CACHE).invalidate('team');
 
     return new Response(JSON.stringify({ success: true }), {
       headers: { ...corsHeaders, 'Content-Type': 'application/json' }
@@ -1,6 +1,11 @@
 // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-// SERVICE FACTORY - Singleton pattern para servicios
-// Evita crear múltiples instancias de servicios en cada request
+// SERVICE FACTORY - Construcción lazy de servicios
+// - ServiceFactory: instancias compartidas por isolate (Claude, Calendar
+//   con su token OAuth, Twilio) — no guardan estado del request
+// - RequestServices: scope de un request/CRON; crea Supabase, Cache y Meta
+//   en el primer uso y carga con import() los módulos pesados (PDF, email
+//   mensual, Retell)
+// Cada construcción se mide (ms) por servicio, por request y en el cold start
 // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 import { SupabaseService } from './supabase';
@@ -12,10 +17,89 @@ import { NotificationService } from './notificationService';
 import { BroadcastQueueService } from './broadcastQueueService';
 import { AppointmentService } from './appointmentService';
 import { TwilioService } from './twilio';
+import { CacheService, getCacheService } from './cacheService';
+import { reportEntityCache } from './entityCache';
+import type { PDFReportService } from './pdfReportService';
+import type { MonthlyEmailReportService } from './monthlyEmailReportService';
+import type { RetellService } from './retellService';
 
 export type { Env } from '../types/env';
 import type { Env } from '../types/env';
 
+// ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+// INSTRUMENTACIÓN - tiempo de construcción por servicio (isolate)
+// ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+export interface ServiceConstructionStats {
+  isolateAgeMs: number;
+  requests: number;
+  avgRequestMs: number;
+  maxRequestMs: number;
+  coldStart: Record<string, number>; // ms de la primera construcción en el isolate
+  services: Record<string, { count: number; totalMs: number; avgMs: number; maxMs: number }>;
+}
+
+let isolateStartedAt = Date.now();
+const constructionTimings = new Map<string, { count: number; totalMs: number; maxMs: number; firstMs: number }>();
+const requestTimings = { count: 0, totalMs: 0, maxMs: 0 };
+
+function recordConstruction(name: string, ms: number): void {
+  const t = constructionTimings.get(name);
+  if (!t) {
+    constructionTimings.set(name, { count: 1, totalMs: ms, maxMs: ms, firstMs: ms });
+    return;
+  }
+  t.count++;
+  t.totalMs += ms;
+  if (ms > t.maxMs) t.maxMs = ms;
+}
+
+function timed<T>(name: string, build: () => T): { value: T; ms: number } {
+  const start = performance.now();
+  const value = build();
+  const ms = performance.now() - start;
+  recordConstruction(name, ms);
+  return { value, ms };
+}
+
+async function timedAsync<T>(name: string, build: () => Promise<T>): Promise<{ value: T; ms: number }> {
+  const start = performance.now();
+  const value = await build();
+  const ms = performance.now() - start;
+  recordConstruction(name, ms);
+  return { value, ms };
+}
+
+export function getServiceConstructionStats(): ServiceConstructionStats {
+  const coldStart: Record<string, number> = {};
+  const services: ServiceConstructionStats['services'] = {};
+  for (const [name, t] of constructionTimings) {
+    coldStart[name] = +t.firstMs.toFixed(2);
+    services[name] = {
+      count: t.count,
+      totalMs: +t.totalMs.toFixed(2),
+      avgMs: +(t.totalMs / t.count).toFixed(2),
+      maxMs: +t.maxMs.toFixed(2),
+    };
+  }
+  return {
+    isolateAgeMs: Date.now() - isolateStartedAt,
+    requests: requestTimings.count,
+    avgRequestMs: requestTimings.count > 0 ? +(requestTimings.totalMs / requestTimings.count).toFixed(2) : 0,
+    maxRequestMs: +requestTimings.maxMs.toFixed(2),
+    coldStart,
+    services,
+  };
+}
+
+export function resetServiceConstructionStats(): void {
+  constructionTimings.clear();
+  requestTimings.count = 0;
+  requestTimings.totalMs = 0;
+  requestTimings.maxMs = 0;
+  isolateStartedAt = Date.now();
+}
+
 /**
  * ServiceFactory - Crea y cachea instancias de servicios
  *
@@ -50,49 +134,49 @@ export class ServiceFactory {
 
   getSupabase(): SupabaseService {
     if (!this._supabase) {
-      this._supabase = new SupabaseService(
+      this._supabase = timed('supabase', () => new SupabaseService(
         this.env.SUPABASE_URL,
         this.env.SUPABASE_ANON_KEY
-      );
+      )).value;
     }
     return this._supabase;
   }
 
   getClaude(): ClaudeService {
     if (!this._claude) {
-      this._claude = new ClaudeService(this.env.ANTHROPIC_API_KEY);
+      this._claude = timed('claude', () => new ClaudeService(this.env.ANTHROPIC_API_KEY)).value;
     }
     return this._claude;
   }
 
   getMeta(): MetaWhatsAppService {
     if (!this._meta) {
-      this._meta = new MetaWhatsAppService(
+      this._meta = timed('meta', () => new MetaWhatsAppService(
         this.env.META_PHONE_NUMBER_ID,
         this.env.META_ACCESS_TOKEN
-      );
+      )).value;
     }
     return this._meta;
   }
 
   getCalendar(): CalendarService {
     if (!this._calendar) {
-      this._calendar = new CalendarService(
+      this._calendar = timed('calendar', () => new CalendarService(
         this.env.GOOGLE_SERVICE_ACCOUNT_EMAIL,
         this.env.GOOGLE_PRIVATE_KEY,
         this.env.GOOGLE_CALENDAR_ID
-      );
+      )).value;
     }
     return this._calendar;
   }
 
   getTwilio(): TwilioService {
     if (!this._twilio) {
-      this._twilio = new TwilioService(
+      this._twilio = timed('twilio', () => new TwilioService(
         this.env.TWILIO_ACCOUNT_SID,
         this.env.TWILIO_AUTH_TOKEN,
         this.env.TWILIO_PHONE_NUMBER
-      );
+      )).value;
     }
     return this._twilio;
   }
@@ -103,40 +187,40 @@ export class ServiceFactory {
 
   getFollowup(): FollowupService {
     if (!this._followup) {
-      this._followup = new FollowupService(
+      this._followup = timed('followup', () => new FollowupService(
         this.getSupabase()
-      );
+      )).value;
     }
     return this._followup;
   }
 
   getNotification(): NotificationService {
     if (!this._notification) {
-      this._notification = new NotificationService(
+      this._notification = timed('notification', () => new NotificationService(
         this.getSupabase(),
         this.getMeta(),
         this.env.OPENAI_API_KEY
-      );
+      )).value;
     }
     return this._notification;
   }
 
   getBroadcast(): BroadcastQueueService {
     if (!this._broadcast) {
-      this._broadcast = new BroadcastQueueService(
+      this._broadcast = timed('broadcast', () => new BroadcastQueueService(
         this.getSupabase()
-      );
+      )).value;
     }
     return this._broadcast;
   }
 
   getAppointment(): AppointmentService {
     if (!this._appointment) {
-      this._appointment = new AppointmentService(
+      this._appointment = timed('appointment', () => new AppointmentService(
         this.getSupabase(),
         this.getCalendar(),
         this.getTwilio()
-      );
+      )).value;
     }
     return this._appointment;
   }
@@ -198,3 +282,129 @@ export function getServiceFactory(env: Env): ServiceFactory {
 
   return globalFactory;
 }
+
+// ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+// REQUEST SCOPE: servicios lazy de un request / iteración de CRON
+// ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+/**
+ * RequestServices - Construye cada servicio en su primer uso
+ *
+ * Supabase (tenant), Cache (waitUntil) y Meta (config del tenant) son del
+ * request; Claude, Calendar y Twilio se comparten vía getServiceFactory().
+ * Un preflight o /health no construye nada que no use.
+ *
+ * Uso:
+ * ```
+ * const services = new RequestServices(env, ctx);
+ * const supabase = services.getSupabase();
+ * const pdf = await services.getPdfReports();
+ * services.finish(); // registra el tiempo de construcción del request
+ * ```
+ */
+export class RequestServices {
+  private instances = new Map<string, any>();
+  private pending = new Map<string, Promise<any>>();
+  private constructionMs = 0;
+  private finished = false;
+
+  constructor(
+    private env: Env,
+    private ctx?: ExecutionContext,
+    private shared: ServiceFactory = getServiceFactory(env)
+  ) {}
+
+  private lazy<T>(name: string, build: () => T): T {
+    if (this.instances.has(name)) return this.instances.get(name);
+    const { value, ms } = timed(name, build);
+    this.constructionMs += ms;
+    this.instances.set(name, value);
+    return value;
+  }
+
+  /** Módulo pesado: import() + construcción una sola vez por request */
+  private lazyAsync<T>(name: string, build: () => Promise<T>): Promise<T> {
+    if (this.instances.has(name)) return Promise.resolve(this.instances.get(name));
+    let p = this.pending.get(name);
+    if (!p) {
+      p = timedAsync(name, build).then(({ value, ms }) => {
+        this.constructionMs += ms;
+        this.instances.set(name, value);
+        this.pending.delete(name);
+        return value;
+      });
+      this.pending.set(name, p);
+    }
+    return p;
+  }
+
+  getSupabase(): SupabaseService {
+    return this.lazy('supabase', () => new SupabaseService(this.env.SUPABASE_URL, this.env.SUPABASE_ANON_KEY));
+  }
+
+  getCache(): CacheService {
+    // Instancia del isolate (memoria, LRU y stats entre requests); el waitUntil es de este request
+    return this.lazy('cache', () => getCacheService(this.env.SARA_CACHE, this.ctx ? (p) => this.ctx!.waitUntil(p) : undefined));
+  }
+
+  getMeta(): MetaWhatsAppService {
+    return this.lazy('meta', () => new MetaWhatsAppService(this.env.META_PHONE_NUMBER_ID, this.env.META_ACCESS_TOKEN));
+  }
+
+  getClaude(): ClaudeService {
+    return this.shared.getClaude();
+  }
+
+  getCalendar(): CalendarService {
+    return this.shared.getCalendar();
+  }
+
+  getTwilio(): TwilioService {
+    return this.shared.getTwilio();
+  }
+
+  getPdfReports(): Promise<PDFReportService> {
+    return this.lazyAsync('pdf_reports', async () => {
+      const { PDFReportService } = await import('./pdfReportService');
+      return new PDFReportService(this.getSupabase());
+    });
+  }
+
+  getMonthlyEmailReports(): Promise<MonthlyEmailReportService> {
+    return this.lazyAsync('monthly_email_reports', async () => {
+      const { MonthlyEmailReportService } = await import('./monthlyEmailReportService');
+      return new MonthlyEmailReportService(this.getSupabase(), this.env);
+    });
+  }
+
+  /** null si Retell no está configurado */
+  getRetell(): Promise<RetellService | null> {
+    return this.lazyAsync('retell', async () => {
+      if (!this.env.RETELL_API_KEY || !this.env.RETELL_AGENT_ID) return null;
+      const { createRetellService } = await import('./retellService');
+      return createRetellService(this.env.RETELL_API_KEY, this.env.RETELL_AGENT_ID, this.env.RETELL_PHONE_NUMBER || '');
+    });
+  }
+
+  /** Servicios construidos en este scope (para logs/tests) */
+  getConstructed(): string[] {
+    return [...this.instances.keys()];
+  }
+
+  getConstructionMs(): number {
+    return this.constructionMs;
+  }
+
+  /**
+   * Cierra el scope: suma su tiempo de construcción a las métricas del isolate
+   * y reporta el hit rate del EntityCache si el request lo usó
+   */
+  finish(label: string = 'request'): void {
+    if (this.finished) return;
+    this.finished = true;
+    requestTimings.count++;
+    requestTimings.totalMs += this.constructionMs;
+    if (this.constructionMs > requestTimings.maxMs) requestTimings.maxMs = this.constructionMs;
+    reportEntityCache(this.instances.get('supabase'), label);
+  }
+}
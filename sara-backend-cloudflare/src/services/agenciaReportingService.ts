@@ -10,9 +10,13 @@
 // - Mejor/peor campaña
 // - Segmentación de leads
 //
+// Leads por fuente, métricas, ROI y resumen leen contadores (migración 016)
+// en vez de todos los leads del periodo; sin la migración se consulta leads.
+//
 // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 import { SupabaseService } from './supabase';
+import { createCampaignCounterBuffer, CAMPAIGN_LOG_BATCH_SIZE } from './campaignCounterService';
 
 // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 // INTERFACES
@@ -48,6 +52,16 @@ export interface SourceMetrics {
   conversion: number;
 }
 
+export interface SourceCounter {
+  source: string;
+  leads: number;
+  scheduled: number;
+  visited: number;
+  hot: number;
+  won: number;
+  revenue: number;
+}
+
 export interface SegmentCounts {
   total: number;
   hot: number;
@@ -68,6 +82,59 @@ export interface SegmentCounts {
 export class AgenciaReportingService {
   constructor(private supabase: SupabaseService) {}
 
+  // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+  // CONTADORES (migración 016)
+  // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+  /** Leads por fuente desde el mes de `since` (null = histórico). null si no hay migración. */
+  private async getSourceCounters(since: Date | null): Promise<SourceCounter[] | null> {
+    const { data, error } = await this.supabase.client
+      .rpc('marketing_source_summary', { p_since: since ? since.toISOString().split('T')[0] : null });
+
+    if (error || !Array.isArray(data)) {
+      if (error && error.code !== 'PGRST202' && error.code !== '42883') {
+        console.error('⚠️ marketing_source_summary error:', error.message);
+      }
+      return null;
+    }
+
+    return data.map((r: any) => ({
+      source: r.source,
+      leads: Number(r.leads) || 0,
+      scheduled: Number(r.scheduled) || 0,
+      visited: Number(r.visited) || 0,
+      hot: Number(r.hot) || 0,
+      won: Number(r.won) || 0,
+      revenue: Number(r.revenue) || 0
+    }));
+  }
+
+  /** Totales de campaign_counters (costo + embudo de broadcasts). null si no hay migración. */
+  private async getCampaignTotals(): Promise<{ cost: number; sent: number; delivered: number; read: number; replied: number } | null> {
+    const { data, error } = await this.supabase.client
+      .from('campaign_counters')
+      .select('sent, delivered, read, replied, cost');
+
+    if (error || !data) return null;
+
+    const totals = { cost: 0, sent: 0, delivered: 0, read: 0, replied: 0 };
+    for (const c of data) {
+      totals.cost += Number(c.cost) || 0;
+      totals.sent += c.sent || 0;
+      totals.delivered += c.delivered || 0;
+      totals.read += c.read || 0;
+      totals.replied += c.replied || 0;
+    }
+    return totals;
+  }
+
+  private inicioMes(): Date {
+    const inicioMes = new Date();
+    inicioMes.setDate(1);
+    inicioMes.setHours(0, 0, 0, 0);
+    return inicioMes;
+  }
+
   // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
   // CAMPAÑAS ACTIVAS
   // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -148,28 +215,37 @@ export class AgenciaReportingService {
   // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
   async getLeadsPorFuente(): Promise<{ metrics: SourceMetrics[]; total: number; mensaje: string }> {
-    const inicioMes = new Date();
-    inicioMes.setDate(1);
-    inicioMes.setHours(0, 0, 0, 0);
-
-    const { data: leads } = await this.supabase.client
-      .from('leads')
-      .select('source, status, created_at')
-      .gte('created_at', inicioMes.toISOString());
-
-    if (!leads || leads.length === 0) {
-      return { metrics: [], total: 0, mensaje: 'No hay leads este mes.' };
-    }
-
-    // Agrupar por fuente
+    const inicioMes = this.inicioMes();
     const porFuente: Record<string, { total: number; hot: number }> = {};
-    for (const l of leads) {
-      const fuente = l.source || 'Directo';
-      if (!porFuente[fuente]) porFuente[fuente] = { total: 0, hot: 0 };
-      porFuente[fuente].total++;
-      if (['negotiation', 'reserved', 'closed'].includes(l.status)) {
-        porFuente[fuente].hot++;
+    let total = 0;
+
+    const counters = await this.getSourceCounters(inicioMes);
+    if (counters) {
+      for (const c of counters) {
+        if (c.leads <= 0) continue;
+        porFuente[c.source] = { total: c.leads, hot: c.hot };
+        total += c.leads;
       }
+    } else {
+      const { data: leads } = await this.supabase.client
+        .from('leads')
+        .select('source, status, created_at')
+        .gte('created_at', inicioMes.toISOString());
+
+      // Agrupar por fuente
+      for (const l of leads || []) {
+        const fuente = l.source || 'Directo';
+        if (!porFuente[fuente]) porFuente[fuente] = { total: 0, hot: 0 };
+        porFuente[fuente].total++;
+        if (['negotiation', 'reserved', 'closed'].includes(l.status)) {
+          porFuente[fuente].hot++;
+        }
+      }
+      total = leads?.length || 0;
+    }
+
+    if (total === 0) {
+      return { metrics: [], total: 0, mensaje: 'No hay leads este mes.' };
     }
 
     const sorted = Object.entries(porFuente)
@@ -185,9 +261,9 @@ export class AgenciaReportingService {
       msg += `*${item.fuente}*\n`;
       msg += `   Total: ${item.total} | HOT: ${item.hot} | Conv: ${item.conversion}%\n`;
     }
-    msg += `\n*TOTAL: ${leads.length} leads*`;
+    msg += `\n*TOTAL: ${total} leads*`;
 
-    return { metrics: sorted, total: leads.length, mensaje: msg };
+    return { metrics: sorted, total, mensaje: msg };
   }
 
   // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -195,46 +271,58 @@ export class AgenciaReportingService {
   // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
   async getMetricasMes(): Promise<string> {
-    const inicioMes = new Date();
-    inicioMes.setDate(1);
-    inicioMes.setHours(0, 0, 0, 0);
-
-    const { count: countTotal } = await this.supabase.client
-      .from('leads')
-      .select('*', { count: 'exact', head: true })
-      .gte('created_at', inicioMes.toISOString());
-
-    const { data: leads } = await this.supabase.client
-      .from('leads')
-      .select('status, source')
-      .gte('created_at', inicioMes.toISOString());
-
-    const { data: campanas } = await this.supabase.client
-      .from('marketing_campaigns')
-      .select('name, budget, budget_spent, leads_count')
-      .eq('status', 'active');
-
-    const leadsArr = leads || [];
-    const scheduled = leadsArr.filter(l => l.status === 'scheduled').length;
-    const visited = leadsArr.filter(l => l.status === 'visited').length;
-    const closed = leadsArr.filter(l => ['closed', 'delivered'].includes(l.status)).length;
-
-    // Métricas por fuente
+    const inicioMes = this.inicioMes();
+
+    const [counters, { data: campanas }] = await Promise.all([
+      this.getSourceCounters(inicioMes),
+      this.supabase.client
+        .from('marketing_campaigns')
+        .select('name, budget, budget_spent, leads_count')
+        .eq('status', 'active')
+    ]);
+
+    let countTotal = 0;
+    let scheduled = 0;
+    let visited = 0;
+    let closed = 0;
     const porFuente: Record<string, number> = {};
-    leadsArr.forEach(l => {
-      const src = l.source || 'Directo';
-      porFuente[src] = (porFuente[src] || 0) + 1;
-    });
+
+    if (counters) {
+      for (const c of counters) {
+        countTotal += c.leads;
+        scheduled += c.scheduled;
+        visited += c.visited;
+        closed += c.won;
+        if (c.leads > 0) porFuente[c.source] = c.leads;
+      }
+    } else {
+      const { data: leads } = await this.supabase.client
+        .from('leads')
+        .select('status, source')
+        .gte('created_at', inicioMes.toISOString());
+
+      const leadsArr = leads || [];
+      countTotal = leadsArr.length;
+      scheduled = leadsArr.filter(l => l.status === 'scheduled').length;
+      visited = leadsArr.filter(l => l.status === 'visited').length;
+      closed = leadsArr.filter(l => ['closed', 'delivered'].includes(l.status)).length;
+
+      // Métricas por fuente
+      leadsArr.forEach(l => {
+        const src = l.source || 'Directo';
+        porFuente[src] = (porFuente[src] || 0) + 1;
+      });
+    }
 
     let msg = `*MÉTRICAS DEL MES*\n━━━━━━━━━━━━━━━━━━━━\n\n`;
-    msg += `*Leads totales:* ${countTotal || 0}\n`;
+    msg += `*Leads totales:* ${countTotal}\n`;
     msg += `Con cita: ${scheduled}\n`;
     msg += `Visitaron: ${visited}\n`;
     msg += `Cerrados: ${closed}\n\n`;
 
     // Tasa de conversión
-    const tasaCita = countTotal && countTotal > 0 ? Math.round((scheduled / countTotal) * 100) : 0;
-    const tasaCierre = countTotal && countTotal > 0 ? Math.round((closed / countTotal) * 100) : 0;
+    const tasaCita = countTotal > 0 ? Math.round((scheduled / countTotal) * 100) : 0;
+    const tasaCierre = countTotal > 0 ? Math.round((closed / countTotal) * 100) : 0;
     msg += `*Conversión:*\n`;
     msg += `• Lead→Cita: ${tasaCita}%\n`;
     msg += `• Lead→Cierre: ${tasaCierre}%\n\n`;
@@ -262,26 +350,43 @@ export class AgenciaReportingService {
   // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
   async getROI(): Promise<string> {
-    const { data: campanas } = await this.supabase.client
-      .from('marketing_campaigns')
-      .select('*');
-
-    const { data: leads } = await this.supabase.client
-      .from('leads')
-      .select('source, status, properties(price)')
-      .in('status', ['closed', 'delivered']);
-
-    const totalGasto = campanas?.reduce((s, c) => s + (c.budget_spent || 0), 0) || 0;
+    const [counters, totals] = await Promise.all([
+      this.getSourceCounters(null),
+      this.getCampaignTotals()
+    ]);
+
+    let totalGasto = 0;
+    if (totals) {
+      totalGasto = totals.cost;
+    } else {
+      const { data: campanas } = await this.supabase.client
+        .from('marketing_campaigns')
+        .select('budget_spent');
+      totalGasto = campanas?.reduce((s, c) => s + (c.budget_spent || 0), 0) || 0;
+    }
 
     // Calcular revenue por fuente
     let totalRevenue = 0;
     const revenuePorFuente: Record<string, number> = {};
 
-    for (const l of leads || []) {
-      const precio = l.properties?.price || 2000000;
-      totalRevenue += precio;
-      const fuente = l.source || 'Directo';
-      revenuePorFuente[fuente] = (revenuePorFuente[fuente] || 0) + precio;
+    if (counters) {
+      for (const c of counters) {
+        if (c.revenue <= 0) continue;
+        totalRevenue += c.revenue;
+        revenuePorFuente[c.source] = c.revenue;
+      }
+    } else {
+      const { data: leads } = await this.supabase.client
+        .from('leads')
+        .select('source, status, properties(price)')
+        .in('status', ['closed', 'delivered']);
+
+      for (const l of leads || []) {
+        const precio = l.properties?.price || 2000000;
+        totalRevenue += precio;
+        const fuente = l.source || 'Directo';
+        revenuePorFuente[fuente] = (revenuePorFuente[fuente] || 0) + precio;
+      }
     }
 
     const roi = totalGasto > 0 ? Math.round(((totalRevenue - totalGasto) / totalGasto) * 100) : 0;
@@ -920,7 +1025,7 @@ export class AgenciaReportingService {
     mensajeTemplate: string,
     filtroDescripcion: string,
     usuarioId: string,
-    enviarMensaje: (phone: string, mensaje: string) => Promise<void>,
+    enviarMensaje: (phone: string, mensaje: string) => Promise<any>,
     sendTemplate?: (phone: string, templateName: string, lang: string, components: any[]) => Promise<any>
   ): Promise<{ enviados: number; errores: number; templateUsados: number }> {
     // Crear campaña en DB
@@ -942,8 +1047,20 @@ export class AgenciaReportingService {
     let templateUsados = 0;
     const hace24h = new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString();
 
+    // campaign_logs en inserts multi-row + contadores de la campaña agrupados
+    const counters = createCampaignCounterBuffer(this.supabase);
+    let pendingLogs: any[] = [];
+    const flushLogs = async () => {
+      if (pendingLogs.length === 0) return;
+      const rows = pendingLogs;
+      pendingLogs = [];
+      const { error } = await this.supabase.client.from('campaign_logs').insert(rows);
+      if (error) console.error(`⚠️ campaign_logs batch insert (${rows.length}):`, error.message);
+    };
+
     for (const lead of leads) {
       try {
+        let result: any;
         const phone = lead.phone.startsWith('52') ? lead.phone : '52' + lead.phone;
         const nombre = lead.name?.split(' ')[0] || '';
         const desarrollo = lead.property_interest || 'nuestros desarrollos';
@@ -956,12 +1073,12 @@ export class AgenciaReportingService {
           const mensaje = mensajeTemplate
             .replace(/{nombre}/gi, nombre)
             .replace(/{desarrollo}/gi, desarrollo);
-          await enviarMensaje(phone, mensaje);
+          result = await enviarMensaje(phone, mensaje);
         } else if (sendTemplate) {
           // Fuera de ventana 24h: usar template aprobado
           // Usar promo_desarrollo: {{1}}=nombre, {{2}}=desarrollo, {{3}}=mensaje_promo
           const mensajeCorto = mensajeTemplate.substring(0, 200).replace(/{nombre}/gi, '').replace(/{desarrollo}/gi, '').trim();
-          await sendTemplate(phone, 'promo_desarrollo', 'es_MX', [
+          result = await sendTemplate(phone, 'promo_desarrollo', 'es_MX', [
             { type: 'body', parameters: [
               { type: 'text', text: nombre },
               { type: 'text', text: desarrollo },
@@ -974,19 +1091,22 @@ export class AgenciaReportingService {
           const mensaje = mensajeTemplate
             .replace(/{nombre}/gi, nombre)
             .replace(/{desarrollo}/gi, desarrollo);
-          await enviarMensaje(phone, mensaje);
+          result = await enviarMensaje(phone, mensaje);
         }
 
-        // Log en campaign_logs
+        // Log en campaign_logs (wamid para atribuir entregas/lecturas)
         if (campana) {
-          await this.supabase.client.from('campaign_logs').insert({
+          pendingLogs.push({
             campaign_id: campana.id,
             lead_id: lead.id,
             lead_phone: lead.phone,
             lead_name: lead.name,
+            message_id: result?.messages?.[0]?.id || null,
             status: 'sent',
             sent_at: new Date().toISOString()
           });
+          counters.bump(campana.id, { sent: 1 });
+          if (pendingLogs.length >= CAMPAIGN_LOG_BATCH_SIZE) await flushLogs();
         }
 
         enviados++;
@@ -995,10 +1115,14 @@ export class AgenciaReportingService {
         await new Promise(r => setTimeout(r, 100));
       } catch (e) {
         errores++;
+        if (campana) counters.bump(campana.id, { failed: 1 });
         console.error(`Error enviando a ${lead.phone}:`, e);
       }
     }
 
+    await flushLogs();
+    await counters.flush();
+
     // Actualizar campaña
     if (campana) {
       await this.supabase.client
@@ -1077,29 +1201,43 @@ export class AgenciaReportingService {
     leadsMesTotal: number;
     leadsHot: number;
     conversionRate: number;
+    broadcasts?: { sent: number; delivered: number; read: number; replied: number };
   }> {
-    const { data: campanas } = await this.supabase.client
-      .from('marketing_campaigns')
-      .select('*');
-
-    const inicioMes = new Date();
-    inicioMes.setDate(1);
+    const inicioMes = this.inicioMes();
 
-    const { data: leadsMes } = await this.supabase.client
-      .from('leads')
-      .select('source, status')
-      .gte('created_at', inicioMes.toISOString());
+    const [{ data: campanas }, counters, totals] = await Promise.all([
+      this.supabase.client
+        .from('marketing_campaigns')
+        .select('status, budget_spent, leads_generated'),
+      this.getSourceCounters(inicioMes),
+      this.getCampaignTotals()
+    ]);
 
     const activas = campanas?.filter(c => c.status === 'active').length || 0;
     const totalGasto = campanas?.reduce((s, c) => s + (c.budget_spent || 0), 0) || 0;
     const totalLeadsCamp = campanas?.reduce((s, c) => s + (c.leads_generated || 0), 0) || 0;
     const cplGlobal = totalLeadsCamp > 0 ? Math.round(totalGasto / totalLeadsCamp) : 0;
 
-    const leadsMesTotal = leadsMes?.length || 0;
-    const leadsHot = leadsMes?.filter(l => ['negotiation', 'reserved', 'closed'].includes(l.status)).length || 0;
+    let leadsMesTotal = 0;
+    let leadsHot = 0;
+    if (counters) {
+      leadsMesTotal = counters.reduce((s, c) => s + c.leads, 0);
+      leadsHot = counters.reduce((s, c) => s + c.hot, 0);
+    } else {
+      const { data: leadsMes } = await this.supabase.client
+        .from('leads')
+        .select('source, status')
+        .gte('created_at', inicioMes.toISOString());
+      leadsMesTotal = leadsMes?.length || 0;
+      leadsHot = leadsMes?.filter(l => ['negotiation', 'reserved', 'closed'].includes(l.status)).length || 0;
+    }
     const conversionRate = leadsMesTotal > 0 ? Math.round(leadsHot / leadsMesTotal * 100) : 0;
 
-    return { activas, totalGasto, cplGlobal, leadsMesTotal, leadsHot, conversionRate };
+    const broadcasts = totals && totals.sent > 0
+      ? { sent: totals.sent, delivered: totals.delivered, read: totals.read, replied: totals.replied }
+      : undefined;
+
+    return { activas, totalGasto, cplGlobal, leadsMesTotal, leadsHot, conversionRate, broadcasts };
   }
 
   formatResumenMarketing(data: {
@@ -1109,7 +1247,16 @@ export class AgenciaReportingService {
     leadsMesTotal: number;
     leadsHot: number;
     conversionRate: number;
+    broadcasts?: { sent: number; delivered: number; read: number; replied: number };
   }, nombre: string): string {
+    const pct = (n: number, d: number) => d > 0 ? Math.round((n / d) * 100) : 0;
+    const broadcasts = data.broadcasts
+      ? '*Broadcasts:*\n' +
+        `• Enviados: ${data.broadcasts.sent}\n` +
+        `• Entregados: ${pct(data.broadcasts.delivered, data.broadcasts.sent)}%\n` +
+        `• Leídos: ${pct(data.broadcasts.read, data.broadcasts.sent)}%\n` +
+        `• Respondidos: ${pct(data.broadcasts.replied, data.broadcasts.sent)}%\n\n`
+      : '';
     return '*📌 RESUMEN MARKETING*\n' + nombre + '\n\n' +
       '*Campañas:*\n' +
       `• Activas: ${data.activas}\n` +
@@ -1119,6 +1266,7 @@ export class AgenciaReportingService {
       `• Generados: ${data.leadsMesTotal}\n` +
       `• HOT: ${data.leadsHot}\n` +
       `• Conversión: ${data.conversionRate}%\n\n` +
+      broadcasts +
       '💡 Escribe *mejor* o *peor* para ver campañas destacadas.';
   }
 }
@@ -222,6 +222,39 @@ Los siguientes endpoints NO requieren autenticación:
           }
         }
       },
+      '/backup': {
+        get: {
+          summary: 'Backup de Datos',
+          description: 'Exporta leads, citas, equipo y configuración. Por defecto JSONL en streaming: una línea por fila con {"table": string, "row": object}. Con format=json devuelve el objeto JSON anterior ({generated_at, tables}).',
+          tags: ['Sistema'],
+          security: [{ bearerAuth: [] }],
+          parameters: [
+            {
+              name: 'format',
+              in: 'query',
+              description: 'json = formato anterior (en memoria)',
+              schema: { type: 'string', enum: ['jsonl', 'json'], default: 'jsonl' }
+            },
+            {
+              name: 'gzip',
+              in: 'query',
+              description: '1 = JSONL comprimido (application/gzip)',
+              schema: { type: 'string', enum: ['1'] }
+            }
+          ],
+          responses: {
+            '200': {
+              description: 'Backup',
+              content: {
+                'application/x-ndjson': { schema: { type: 'string' } },
+                'application/gzip': { schema: { type: 'string', format: 'binary' } },
+                'application/json': { schema: { type: 'object' } }
+              }
+            },
+            '401': { description: 'No autorizado' }
+          }
+        }
+      },
       '/webhook': {
         get: {
           summary: 'Verificar Webhook',
@@ -1,4 +1,5 @@
 import { SupabaseService } from './supabase';
+import { getEntityCache } from '../services/entityCache';
 import { formatPhoneForDisplay } from '../handlers/whatsapp-utils';
 import { DocumentCollectionService } from './documentCollectionService';
 
@@ -1193,6 +1194,7 @@ Si tienes preguntas, tu asesor está disponible para orientarte.
       .from('team_members')
       .update({ is_on_duty: estado })
       .eq('id', asesorId);
+    await getEntityCache(this.supabase).invalidate('team');
 
     if (estado) {
       return {
@@ -0,0 +1,280 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// BACKUP STREAM SERVICE - Backups JSONL en streaming hacia R2
+// ═══════════════════════════════════════════════════════════════════════════
+// Lecturas paginadas de Supabase → TransformStream (fila → línea JSONL) →
+// CompressionStream('gzip') opcional → R2 multipart upload.
+// Solo hay en memoria una página de filas y una parte de R2 a la vez, sin
+// importar el tamaño de la tabla. Los bytes se cuentan al vuelo.
+// ═══════════════════════════════════════════════════════════════════════════
+
+// ═══════════════════════════════════════════════════════════════════════════
+// TYPES
+// ═══════════════════════════════════════════════════════════════════════════
+
+/** Lee las filas [from, to] (inclusive) — normalmente un query con .range() */
+export type PageFetcher = (from: number, to: number) => PromiseLike<{ data: any[] | null; error: any }>;
+
+/** Lee hasta limit filas con id > afterId (null = desde el inicio), ordenadas por id */
+export type KeysetFetcher = (afterId: string | null, limit: number) => PromiseLike<{ data: any[] | null; error: any }>;
+
+export interface BackupSource {
+  table: string;
+  fetchPage: PageFetcher;
+}
+
+export interface JsonlCounter {
+  rows: number;
+  bytes: number; // bytes JSONL sin comprimir
+}
+
+export interface StreamUploadOptions {
+  gzip?: boolean;
+  pageSize?: number;
+  partSize?: number;
+  mapRow?: (row: any) => any;
+}
+
+export interface StreamUploadResult {
+  key: string;
+  rows: number;
+  bytes: number; // JSONL sin comprimir
+  storedBytes: number; // tamaño del objeto en R2
+  parts: number;
+}
+
+// conversation_history puede pesar decenas de KB por lead: páginas chicas
+export const BACKUP_PAGE_SIZE = 500;
+// Mínimo de R2 para partes que no son la última; todas deben medir lo mismo
+export const R2_PART_SIZE = 5 * 1024 * 1024;
+
+// ═══════════════════════════════════════════════════════════════════════════
+// STREAMS
+// ═══════════════════════════════════════════════════════════════════════════
+
+/**
+ * Stream de filas que pide la siguiente página solo cuando el consumidor
+ * la necesita (pull), así el upload marca el ritmo de las lecturas.
+ */
+export function paginatedRowStream(fetchPage: PageFetcher, pageSize: number = BACKUP_PAGE_SIZE): ReadableStream<any> {
+  let offset = 0;
+  return new ReadableStream<any>({
+    async pull(controller) {
+      const { data, error } = await fetchPage(offset, offset + pageSize - 1);
+      if (error) {
+        controller.error(new Error(`Backup page read failed: ${error.message || error}`));
+        return;
+      }
+      const rows = data || [];
+      for (const row of rows) controller.enqueue(row);
+      offset += pageSize;
+      if (rows.length < pageSize) controller.close();
+    }
+  }, { highWaterMark: 0 });
+}
+
+/**
+ * Como paginatedRowStream pero por keyset (id > último id leído): estable
+ * aunque filas entren o salgan del filtro mientras se lee.
+ */
+export function keysetRowStream(fetchAfter: KeysetFetcher, pageSize: number = BACKUP_PAGE_SIZE): ReadableStream<any> {
+  let afterId: string | null = null;
+  return new ReadableStream<any>({
+    async pull(controller) {
+      const { data, error } = await fetchAfter(afterId, pageSize);
+      if (error) {
+        controller.error(new Error(`Backup page read failed: ${error.message || error}`));
+        return;
+      }
+      const rows = data || [];
+      for (const row of rows) controller.enqueue(row);
+      if (rows.length > 0) afterId = String(rows[rows.length - 1].id);
+      if (rows.length < pageSize) controller.close();
+    }
+  }, { highWaterMark: 0 });
+}
+
+/** Concatena varias tablas en un solo stream de { table, row } */
+export function tablesRowStream(sources: BackupSource[], pageSize: number = BACKUP_PAGE_SIZE): ReadableStream<any> {
+  let index = 0;
+  let reader: ReadableStreamDefaultReader<any> | null = null;
+  return new ReadableStream<any>({
+    async pull(controller) {
+      while (index < sources.length) {
+        if (!reader) reader = paginatedRowStream(sources[index].fetchPage, pageSize).getReader();
+        const { value, done } = await reader.read();
+        if (!done) {
+          controller.enqueue({ table: sources[index].table, row: value });
+          return;
+        }
+        reader = null;
+        index++;
+      }
+      controller.close();
+    },
+    async cancel(reason) {
+      if (reader) await reader.cancel(reason);
+    }
+  }, { highWaterMark: 0 });
+}
+
+/** Fila → línea JSONL codificada, contando filas y bytes al vuelo */
+export function jsonlEncoderStream(counter: JsonlCounter, mapRow?: (row: any) => any): TransformStream<any, Uint8Array> {
+  const encoder = new TextEncoder();
+  return new TransformStream<any, Uint8Array>({
+    transform(row, controller) {
+      const line = encoder.encode(JSON.stringify(mapRow ? mapRow(row) : row) + '\n');
+      counter.rows++;
+      counter.bytes += line.byteLength;
+      controller.enqueue(line);
+    }
+  });
+}
+
+/** Bytes JSONL → filas (parte por líneas; tolera líneas cortadas entre chunks) */
+export function jsonlDecoderStream(): TransformStream<string, any> {
+  let buffer = '';
+  return new TransformStream<string, any>({
+    transform(text, controller) {
+      buffer += text;
+      let newline = buffer.indexOf('\n');
+      while (newline >= 0) {
+        const line = buffer.slice(0, newline);
+        buffer = buffer.slice(newline + 1);
+        if (line.trim()) controller.enqueue(JSON.parse(line));
+        newline = buffer.indexOf('\n');
+      }
+    },
+    flush(controller) {
+      if (buffer.trim()) controller.enqueue(JSON.parse(buffer));
+    }
+  });
+}
+
+/** Pipeline completo filas → JSONL (→ gzip) */
+export function createJsonlStream(rows: ReadableStream<any>, counter: JsonlCounter, options: { gzip?: boolean; mapRow?: (row: any) => any } = {}): ReadableStream<Uint8Array> {
+  const jsonl = rows.pipeThrough(jsonlEncoderStream(counter, options.mapRow));
+  return options.gzip ? jsonl.pipeThrough(new CompressionStream('gzip')) : jsonl;
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// R2 UPLOAD
+// ═══════════════════════════════════════════════════════════════════════════
+
+/** Saca exactamente n bytes del frente de chunks (parte el último si hace falta) */
+function takeBytes(chunks: Uint8Array[], n: number): Uint8Array {
+  const out = new Uint8Array(n);
+  let filled = 0;
+  while (filled < n) {
+    const chunk = chunks[0];
+    const needed = n - filled;
+    if (chunk.byteLength <= needed) {
+      out.set(chunk, filled);
+      filled += chunk.byteLength;
+      chunks.shift();
+    } else {
+      out.set(chunk.subarray(0, needed), filled);
+      chunks[0] = chunk.subarray(needed);
+      filled = n;
+    }
+  }
+  return out;
+}
+
+/**
+ * Sube un stream de bytes a R2. Si cabe en una parte se usa un put simple;
+ * si no, multipart con partes de tamaño fijo (abort si algo falla).
+ */
+export async function uploadStreamToR2(
+  r2: R2Bucket,
+  key: string,
+  stream: ReadableStream<Uint8Array>,
+  options: { contentType?: string; partSize?: number } = {}
+): Promise<{ storedBytes: number; parts: number }> {
+  const partSize = options.partSize || R2_PART_SIZE;
+  const httpMetadata = { contentType: options.contentType || 'application/jsonl' };
+  const reader = stream.getReader();
+  const pending: Uint8Array[] = [];
+  const uploaded: R2UploadedPart[] = [];
+  let pendingBytes = 0;
+  let storedBytes = 0;
+  let upload: R2MultipartUpload | null = null;
+
+  try {
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      pending.push(value);
+      pendingBytes += value.byteLength;
+      storedBytes += value.byteLength;
+
+      while (pendingBytes >= partSize) {
+        if (!upload) upload = await r2.createMultipartUpload(key, { httpMetadata });
+        const part = takeBytes(pending, partSize);
+        pendingBytes -= partSize;
+        uploaded.push(await upload.uploadPart(uploaded.length + 1, part));
+      }
+    }
+
+    const tail = takeBytes(pending, pendingBytes);
+    if (!upload) {
+      await r2.put(key, tail, { httpMetadata });
+      return { storedBytes, parts: 1 };
+    }
+    if (tail.byteLength > 0) uploaded.push(await upload.uploadPart(uploaded.length + 1, tail));
+    await upload.complete(uploaded);
+    return { storedBytes, parts: uploaded.length };
+  } catch (e) {
+    await reader.cancel(e).catch(() => {});
+    if (upload) await upload.abort().catch(() => {});
+    throw e;
+  }
+}
+
+/** Lee una tabla paginada y la deja en R2 como JSONL (o JSONL.gz) */
+export async function streamRowsToR2(
+  r2: R2Bucket,
+  key: string,
+  fetchPage: PageFetcher,
+  options: StreamUploadOptions = {}
+): Promise<StreamUploadResult> {
+  return uploadRowsToR2(r2, key, paginatedRowStream(fetchPage, options.pageSize), options);
+}
+
+/** Cualquier stream de filas → objeto JSONL (o JSONL.gz) en R2 */
+export async function uploadRowsToR2(
+  r2: R2Bucket,
+  key: string,
+  rows: ReadableStream<any>,
+  options: StreamUploadOptions = {}
+): Promise<StreamUploadResult> {
+  const counter: JsonlCounter = { rows: 0, bytes: 0 };
+  const stream = createJsonlStream(rows, counter, options);
+  const { storedBytes, parts } = await uploadStreamToR2(r2, key, stream, {
+    contentType: options.gzip ? 'application/gzip' : 'application/jsonl',
+    partSize: options.partSize
+  });
+  return { key, rows: counter.rows, bytes: counter.bytes, storedBytes, parts };
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// R2 READ / DELETE
+// ═══════════════════════════════════════════════════════════════════════════
+
+/** Stream de filas de un objeto JSONL en R2 (.gz se descomprime). null si no existe */
+export async function readJsonlFromR2(r2: R2Bucket, key: string): Promise<ReadableStream<any> | null> {
+  const object = await r2.get(key);
+  if (!object) return null;
+  const bytes = key.endsWith('.gz') ? object.body.pipeThrough(new DecompressionStream('gzip')) : object.body;
+  return bytes.pipeThrough(new TextDecoderStream()).pipeThrough(jsonlDecoderStream());
+}
+
+// R2 acepta hasta 1000 keys por delete
+const R2_DELETE_BATCH = 1000;
+
+/** Borra objetos en lotes (una llamada por cada 1000 keys) */
+export async function deleteR2Keys(r2: R2Bucket, keys: string[]): Promise<number> {
+  for (let i = 0; i < keys.length; i += R2_DELETE_BATCH) {
+    await r2.delete(keys.slice(i, i + R2_DELETE_BATCH));
+  }
+  return keys.length;
+}
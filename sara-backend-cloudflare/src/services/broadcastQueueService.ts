@@ -6,9 +6,15 @@
  */
 
 import { SupabaseService } from './supabase';
+import type { SendManyJob, SendManyResult } from './meta-whatsapp';
 
 const BATCH_SIZE = 15; // Leads por lote (dentro del límite de Cloudflare)
 const BROADCAST_RESPONSE_WINDOW_HOURS = 48; // Ventana para detectar respuestas
+// Subrequests estimados por job: envío + tracking por lead, más lecturas/updates del job
+const JOB_SUBREQUESTS = BATCH_SIZE * 2 + 6;
+
+// Envío en lote (MetaWhatsAppService.sendMany): resultados en el mismo orden que los jobs
+type SendManyFn = (jobs: SendManyJob[]) => Promise<SendManyResult[]>;
 
 export interface BroadcastJob {
   id: string;
@@ -78,7 +84,9 @@ export class BroadcastQueueService {
    */
   async processPendingBroadcasts(
     sendTemplate: (phone: string, templateName: string, lang: string, components: any[]) => Promise<any>,
-    sendMessage?: (phone: string, message: string) => Promise<any>
+    sendMessage?: (phone: string, message: string) => Promise<any>,
+    sendMany?: SendManyFn,
+    canAfford?: (subrequests: number) => boolean // presupuesto del CRON (SubrequestGovernor)
   ): Promise<{ processed: number; sent: number; errors: number }> {
 
     // 🚨 KILL SWITCH - Si no hay config o está en false, NO PROCESAR
@@ -117,7 +125,11 @@ export class BroadcastQueueService {
     console.log(`📤 QUEUE: Procesando ${jobs.length} broadcasts pendientes`);
 
     for (const job of jobs) {
-      const result = await this.processJob(job, sendTemplate, sendMessage);
+      if (canAfford && !canAfford(JOB_SUBREQUESTS)) {
+        console.warn(`⏭️ QUEUE: presupuesto de subrequests agotado, job ${job.id} sigue en el siguiente CRON`);
+        break;
+      }
+      const result = await this.processJob(job, sendTemplate, sendMessage, sendMany);
       totalProcessed++;
       totalSent += result.sent;
       totalErrors += result.errors;
@@ -132,7 +144,8 @@ export class BroadcastQueueService {
   private async processJob(
     job: BroadcastJob,
     sendTemplate: (phone: string, templateName: string, lang: string, components: any[]) => Promise<any>,
-    sendMessage?: (phone: string, message: string) => Promise<any>
+    sendMessage?: (phone: string, message: string) => Promise<any>,
+    sendMany?: SendManyFn
   ): Promise<{ sent: number; errors: number; completed: boolean }> {
     let sent = 0;
     let errors = 0;
@@ -171,6 +184,7 @@ export class BroadcastQueueService {
     const sentIds: string[] = [];
     const failedIds: string[] = [];
     const sentLeadsByVendor: Map<string, { name: string; phone: string }[]> = new Map();
+    const toSend: typeof leads = [];
 
     // Enviar a cada lead
     for (const lead of leads) {
@@ -205,56 +219,84 @@ export class BroadcastQueueService {
         }
       }
 
-      try {
-        // Preparar mensaje personalizado
-        const nombre = lead.name || 'Cliente';
-        const desarrollo = lead.property_interest || 'nuestros desarrollos';
-        // Tercer parámetro: mensaje promocional (limpiar placeholders)
-        const mensajePromo = job.message_template
-          .replace(/{nombre}/gi, '')
-          .replace(/{desarrollo}/gi, '')
-          .trim()
-          .substring(0, 200) || 'Promoción especial disponible';
-
-        // Usar template de WhatsApp (3 params: nombre, desarrollo, mensaje)
-        await sendTemplate(lead.phone, 'promo_desarrollo', 'es_MX', [
+      toSend.push(lead);
+    }
+
+    // Preparar mensaje personalizado
+    // Tercer parámetro: mensaje promocional (limpiar placeholders)
+    const mensajePromo = job.message_template
+      .replace(/{nombre}/gi, '')
+      .replace(/{desarrollo}/gi, '')
+      .trim()
+      .substring(0, 200) || 'Promoción especial disponible';
+
+    // Usar template de WhatsApp (3 params: nombre, desarrollo, mensaje)
+    const templateJobs: SendManyJob[] = toSend.map(lead => ({
+      to: lead.phone,
+      template: {
+        name: 'promo_desarrollo',
+        languageCode: 'es_MX',
+        components: [
           {
             type: 'body',
             parameters: [
-              { type: 'text', text: nombre },
-              { type: 'text', text: desarrollo },
+              { type: 'text', text: lead.name || 'Cliente' },
+              { type: 'text', text: lead.property_interest || 'nuestros desarrollos' },
               { type: 'text', text: mensajePromo }
             ]
           }
-        ]);
+        ]
+      }
+    }));
+
+    // Con sendMany: concurrente bajo el rate limit global; sin él, uno por uno
+    let outcomes: Array<{ ok: boolean; error?: string }>;
+    if (sendMany) {
+      outcomes = await sendMany(templateJobs);
+    } else {
+      outcomes = [];
+      for (const tj of templateJobs) {
+        try {
+          await sendTemplate(tj.to, tj.template!.name, tj.template!.languageCode!, tj.template!.components!);
+          outcomes.push({ ok: true });
+        } catch (e) {
+          outcomes.push({ ok: false, error: (e as Error)?.message || String(e) });
+        }
+      }
+    }
+
+    for (let i = 0; i < toSend.length; i++) {
+      const lead = toSend[i];
+      const outcome = outcomes[i];
+      if (!outcome?.ok) {
+        console.error(`❌ QUEUE: Error enviando a ${lead.phone}:`, outcome?.error);
+        failedIds.push(lead.id);
+        errors++;
+        continue;
+      }
 
-        sentIds.push(lead.id);
-        sent++;
-        console.log(`✅ QUEUE: Template enviado a ${lead.phone}`);
+      sentIds.push(lead.id);
+      sent++;
+      console.log(`✅ QUEUE: Template enviado a ${lead.phone}`);
 
-        // Marcar en notes del lead que recibió broadcast
-        await this.markLeadWithBroadcast(lead.id, lead.notes, job);
+      // Marcar en notes del lead que recibió broadcast
+      await this.markLeadWithBroadcast(lead.id, lead.notes, job);
 
-        // Agrupar por vendedor para notificar
-        if (lead.assigned_to) {
-          if (!sentLeadsByVendor.has(lead.assigned_to)) {
-            sentLeadsByVendor.set(lead.assigned_to, []);
-          }
-          sentLeadsByVendor.get(lead.assigned_to)!.push({
-            name: lead.name || 'Sin nombre',
-            phone: lead.phone
-          });
+      // Agrupar por vendedor para notificar
+      if (lead.assigned_to) {
+        if (!sentLeadsByVendor.has(lead.assigned_to)) {
+          sentLeadsByVendor.set(lead.assigned_to, []);
         }
-      } catch (e) {
-        console.error(`❌ QUEUE: Error enviando a ${lead.phone}:`, e);
-        failedIds.push(lead.id);
-        errors++;
+        sentLeadsByVendor.get(lead.assigned_to)!.push({
+          name: lead.name || 'Sin nombre',
+          phone: lead.phone
+        });
       }
     }
 
     // Notificar a vendedores sobre sus leads que recibieron broadcast
     if (sendMessage && sentLeadsByVendor.size > 0) {
-      await this.notifyVendors(sentLeadsByVendor, job, sendMessage);
+      await this.notifyVendors(sentLeadsByVendor, job, sendMessage, sendMany);
     }
 
     // Actualizar el job
@@ -315,7 +357,8 @@ export class BroadcastQueueService {
   private async notifyVendors(
     leadsByVendor: Map<string, { name: string; phone: string }[]>,
     job: BroadcastJob,
-    sendMessage: (phone: string, message: string) => Promise<any>
+    sendMessage: (phone: string, message: string) => Promise<any>,
+    sendMany?: SendManyFn
   ): Promise<void> {
     // Obtener datos de vendedores
     const vendorIds = Array.from(leadsByVendor.keys());
@@ -331,6 +374,7 @@ export class BroadcastQueueService {
       .replace(/{desarrollo}/gi, '[desarrollo]')
       .substring(0, 80);
 
+    const notificaciones: Array<{ vendor: any; mensaje: string }> = [];
     for (const vendor of vendors) {
       if (!vendor.phone) continue;
 
@@ -346,6 +390,20 @@ export class BroadcastQueueService {
         `📝 Mensaje: "${mensajeCorto}..."\n\n` +
         `⚡ Si responden, te notificaré con el contexto.`;
 
+      notificaciones.push({ vendor, mensaje });
+    }
+
+    if (sendMany) {
+      const results = await sendMany(notificaciones.map(n => ({ to: n.vendor.phone, text: n.mensaje, bypassRateLimit: false })));
+      results.forEach((r, i) => {
+        const vendor = notificaciones[i].vendor;
+        if (r.ok) console.log(`📢 QUEUE: Notificación enviada a vendedor ${vendor.name}`);
+        else console.error(`Error notificando a vendedor ${vendor.name}:`, r.error);
+      });
+      return;
+    }
+
+    for (const { vendor, mensaje } of notificaciones) {
       try {
         await sendMessage(vendor.phone, mensaje);
         console.log(`📢 QUEUE: Notificación enviada a vendedor ${vendor.name}`);
@@ -11,24 +11,65 @@ export interface CacheConfig {
   ttl: number; // Time to live in seconds
   staleWhileRevalidate?: number; // Serve stale while fetching fresh data
   tags?: string[]; // For cache invalidation by tag
+  earlyRefreshBeta?: number; // Refresh anticipado probabilístico (XFetch); 0 = desactivado, default 1
 }
 
 export interface CacheEntry<T> {
   data: T;
   cachedAt: number;
   expiresAt: number;
+  staleUntil?: number; // expiresAt + staleWhileRevalidate: se sirve stale y se refresca en background
   tags: string[];
+  tagVersions?: Record<string, number>; // versión de cada tag (y de '__all__') al momento de escribir
+  fetchMs?: number; // lo que tardó el fetcher: escala la ventana de refresh anticipado
   version: number;
 }
 
+export interface CacheKeyStats {
+  hits: number;
+  misses: number;
+  staleHits: number;
+  bytes: number; // tamaño aproximado en memoria (0 si no está en memoria)
+}
+
 export interface CacheStats {
   hits: number;
   misses: number;
+  staleHits: number;
+  revalidations: number;
+  coalesced: number;       // callers que se colgaron de un fetch en vuelo de la misma key
+  earlyRefreshes: number;  // refreshes anticipados antes de vencer (XFetch)
   hitRate: string;
   totalKeys: number;
+  memoryBytes: number;
+  maxEntries: number;
+  maxBytes: number;
+  evictions: number;       // expulsadas por límite de entradas/bytes (LRU)
+  expired: number;         // vencidas removidas (lazy + barrido)
+  tagInvalidations: number;
+  perKey: Record<string, CacheKeyStats>;
   lastReset: string;
 }
 
+export interface CacheLimits {
+  maxEntries?: number;
+  maxBytes?: number;
+}
+
+// Tier en memoria: LRU acotado por entradas y por bytes aproximados (UTF-16)
+export const CACHE_MEMORY_MAX_ENTRIES = 500;
+export const CACHE_MEMORY_MAX_BYTES = 8 * 1024 * 1024;
+// Barrido de vencidas, como mucho cada 30s (se dispara en escrituras)
+export const CACHE_SWEEP_INTERVAL_MS = 30_000;
+// La versión de un tag leída de KV se reusa este tiempo antes de re-consultarla
+export const CACHE_TAG_CHECK_MS = 5_000;
+// Stats por key: las más recientes
+const CACHE_STATS_MAX_KEYS = 200;
+
+const CACHE_FORMAT_VERSION = 1;
+const TAG_REGISTRY_PREFIX = 'cache:tagv:';
+const ALL_TAG = '__all__'; // invalidateAll = invalidar este tag implícito de todas las entradas
+
 // Default TTLs for different data types
 export const CACHE_TTLS = {
   // Frequently accessed, slow to change
@@ -58,43 +99,106 @@ export const CACHE_TTLS = {
   ai_response_greeting: 1800, // 30 minutes - saludos genéricos
   ai_response_development: 600, // 10 minutes - info de desarrollos
   ai_response_prices: 300, // 5 minutes - precios
+
+  // Dashboards (servidos stale mientras se recalculan)
+  analytics_dashboard: 120, // 2 minutes
+  analytics_dashboard_swr: 600, // +10 minutes stale
+
+  // Forecast: matrices y proyección por día (key incluye la fecha)
+  forecast_daily: 93600, // 26 hours
 } as const;
 
+export type WaitUntilFn = (promise: Promise<any>) => void;
+
+// ═══ Estado del isolate ═══
+// Producción crea un CacheService por request (ServiceFactory), así que el
+// registro de versiones por tag vive a nivel módulo: todas las instancias
+// del isolate reusan la versión leída durante CACHE_TAG_CHECK_MS en vez de
+// pagar un KV get por tag en cada request. Lo mismo el single-flight: dos
+// requests que piden la misma key (full key) comparten un solo fetch.
+const tagVersions: Map<string, { version: number; checkedAt: number }> = new Map();
+const tagReads: Map<string, Promise<number>> = new Map();
+const inFlight: Map<string, Promise<any>> = new Map();
+
+/** Tests: simula un isolate nuevo */
+export function resetCacheIsolateState(): void {
+  tagVersions.clear();
+  tagReads.clear();
+  inFlight.clear();
+}
+
 // ═══════════════════════════════════════════════════════════════════════════
 // SERVICE CLASS
 // ═══════════════════════════════════════════════════════════════════════════
 
 export class CacheService {
-  private memoryCache: Map<string, CacheEntry<any>> = new Map();
-  private stats = { hits: 0, misses: 0, lastReset: new Date().toISOString() };
-  private version = 1;
+  private memoryCache: Map<string, MemorySlot> = new Map();
+  private memoryBytes = 0;
+  private keyStats: Map<string, CacheKeyStats> = new Map();
+  private stats = newStats();
+  private lastSweep = Date.now();
+  private maxEntries: number;
+  private maxBytes: number;
+
+  /**
+   * @param waitUntil ctx.waitUntil del request/CRON: mantiene vivo el refresh en
+   *   background después de responder. Sin él, el refresh corre sin garantía.
+   * @param limits tope del tier en memoria (entradas y bytes aproximados)
+   */
+  constructor(private kv: KVNamespace | null, private waitUntil?: WaitUntilFn, limits?: CacheLimits) {
+    this.maxEntries = limits?.maxEntries ?? CACHE_MEMORY_MAX_ENTRIES;
+    this.maxBytes = limits?.maxBytes ?? CACHE_MEMORY_MAX_BYTES;
+  }
 
-  constructor(private kv: KVNamespace | null) {}
+  setWaitUntil(waitUntil: WaitUntilFn | undefined): void {
+    this.waitUntil = waitUntil;
+  }
 
   // ═══════════════════════════════════════════════════════════════════════════
   // CORE METHODS
   // ═══════════════════════════════════════════════════════════════════════════
 
   async get<T>(key: string): Promise<T | null> {
+    const entry = await this.getEntry<T>(key);
+    if (entry && entry.expiresAt > Date.now()) {
+      this.count(key, 'hits');
+      return entry.data;
+    }
+    this.count(key, 'misses');
+    return null;
+  }
+
+  /**
+   * Entrada todavía utilizable (fresca o dentro de la ventana stale, con sus
+   * tags vigentes), memoria → KV. No cuenta hits/misses: eso lo decide el caller.
+   */
+  private async getEntry<T>(key: string): Promise<CacheEntry<T> | null> {
     const fullKey = this.getFullKey(key);
+    const now = Date.now();
 
     // Try memory cache first
-    const memoryEntry = this.memoryCache.get(fullKey);
-    if (memoryEntry && memoryEntry.expiresAt > Date.now()) {
-      this.stats.hits++;
-      return memoryEntry.data as T;
+    const slot = this.memoryCache.get(fullKey);
+    if (slot) {
+      if (usableUntil(slot.entry) > now && await this.tagsCurrent(slot.entry)) {
+        // LRU: re-insertar al final
+        this.memoryCache.delete(fullKey);
+        this.memoryCache.set(fullKey, slot);
+        return slot.entry as CacheEntry<T>;
+      }
+      // Vencida o invalidada por tag: se saca al leerla (lazy)
+      this.drop(fullKey);
+      this.stats.expired++;
     }
 
     // Try KV cache
     if (this.kv) {
       try {
-        const kvData = await this.kv.get(fullKey, 'json');
-        if (kvData) {
-          const entry = kvData as CacheEntry<T>;
-          if (entry.expiresAt > Date.now() && entry.version === this.version) {
-            this.stats.hits++;
-            this.memoryCache.set(fullKey, entry);
-            return entry.data;
+        const raw = await this.kv.get(fullKey);
+        if (raw) {
+          const entry = JSON.parse(raw) as CacheEntry<T>;
+          if (usableUntil(entry) > now && entry.version === CACHE_FORMAT_VERSION && await this.tagsCurrent(entry)) {
+            this.remember(key, fullKey, entry, raw.length * 2);
+            return entry;
           }
         }
       } catch (err) {
@@ -102,27 +206,40 @@ export class CacheService {
       }
     }
 
-    this.stats.misses++;
     return null;
   }
 
   async set<T>(key: string, data: T, config: CacheConfig): Promise<void> {
+    const tags = config.tags || [];
+    await this.write(key, data, config, await this.getTagVersions([ALL_TAG, ...tags]));
+  }
+
+  /** Escribe con las versiones de tag capturadas ANTES de obtener data */
+  private async write<T>(key: string, data: T, config: CacheConfig, versions: number[], fetchMs?: number): Promise<void> {
     const fullKey = this.getFullKey(key);
     const now = Date.now();
+    const tags = config.tags || [];
+    const stamped: Record<string, number> = {};
+    [ALL_TAG, ...tags].forEach((tag, i) => { stamped[tag] = versions[i]; });
 
     const entry: CacheEntry<T> = {
       data,
       cachedAt: now,
       expiresAt: now + (config.ttl * 1000),
-      tags: config.tags || [],
-      version: this.version
+      staleUntil: now + (config.ttl + (config.staleWhileRevalidate || 0)) * 1000,
+      tags,
+      tagVersions: stamped,
+      fetchMs,
+      version: CACHE_FORMAT_VERSION
     };
 
-    this.memoryCache.set(fullKey, entry);
+    const json = JSON.stringify(entry);
+    this.remember(key, fullKey, entry, json.length * 2);
+    this.maybeSweep(now);
 
     if (this.kv) {
       try {
-        await this.kv.put(fullKey, JSON.stringify(entry), {
+        await this.kv.put(fullKey, json, {
           expirationTtl: config.ttl + (config.staleWhileRevalidate || 0)
         });
       } catch (err) {
@@ -133,7 +250,7 @@ export class CacheService {
 
   async delete(key: string): Promise<void> {
     const fullKey = this.getFullKey(key);
-    this.memoryCache.delete(fullKey);
+    this.drop(fullKey);
     if (this.kv) {
       try {
         await this.kv.delete(fullKey);
@@ -147,32 +264,167 @@ export class CacheService {
   // CONVENIENCE METHODS
   // ═══════════════════════════════════════════════════════════════════════════
 
+  /**
+   * Cache-aside con stale-while-revalidate:
+   * - fresco → se devuelve tal cual; cerca de vencer, con probabilidad creciente
+   *   se refresca en background antes de tiempo (XFetch: keys calientes no
+   *   llegan a vencer y no hay ráfaga de misses al expirar)
+   * - vencido pero dentro de staleWhileRevalidate → se devuelve stale y se
+   *   refresca en background (waitUntil)
+   * - ausente → se espera al fetcher
+   * Misses y refreshes concurrentes de la misma key comparten un solo fetch
+   * (single-flight): una ráfaga al vencer se traduce en una sola query.
+   */
   async getOrFetch<T>(key: string, fetcher: () => Promise<T>, config: CacheConfig): Promise<T> {
-    const cached = await this.get<T>(key);
-    if (cached !== null) return cached;
-    const data = await fetcher();
-    await this.set(key, data, config);
-    return data;
+    const entry = await this.getEntry<T>(key);
+    const now = Date.now();
+
+    if (entry && entry.expiresAt > now) {
+      this.count(key, 'hits');
+      if (this.shouldRefreshEarly(key, entry, config, now)) {
+        this.stats.earlyRefreshes++;
+        this.refreshInBackground(key, fetcher, config);
+      }
+      return entry.data;
+    }
+
+    if (entry) {
+      this.count(key, 'staleHits');
+      this.refreshInBackground(key, fetcher, config);
+      return entry.data;
+    }
+
+    this.count(key, 'misses');
+    return this.refresh(key, fetcher, config);
+  }
+
+  /**
+   * XFetch: refrescar si now - fetchMs * beta * ln(rand) >= expiresAt. La
+   * probabilidad sube a medida que se acerca el vencimiento y con lo que
+   * cuesta el fetch; con un fetch en vuelo no se dispara otro.
+   */
+  private shouldRefreshEarly(key: string, entry: CacheEntry<any>, config: CacheConfig, now: number): boolean {
+    const beta = config.earlyRefreshBeta ?? 1;
+    if (beta <= 0 || !entry.fetchMs || inFlight.has(this.getFullKey(key))) return false;
+    return now - entry.fetchMs * beta * Math.log(Math.random()) >= entry.expiresAt;
+  }
+
+  private refreshInBackground<T>(key: string, fetcher: () => Promise<T>, config: CacheConfig): void {
+    const refresh = this.refresh(key, fetcher, config).catch(err => {
+      console.error(`Cache revalidate error (${key}):`, err);
+    });
+    if (this.waitUntil) {
+      // Instancia del isolate: el waitUntil puede ser de un request ya cerrado
+      try { this.waitUntil(refresh); } catch { /* ctx ya cerrado */ }
+    }
+  }
+
+  /** Ejecuta el fetcher y guarda el resultado; una sola ejecución por key a la vez */
+  private refresh<T>(key: string, fetcher: () => Promise<T>, config: CacheConfig): Promise<T> {
+    const fullKey = this.getFullKey(key);
+    const pending = inFlight.get(fullKey);
+    if (pending) {
+      this.stats.coalesced++;
+      return pending as Promise<T>;
+    }
+
+    this.stats.revalidations++;
+    const promise = (async () => {
+      try {
+        // Versiones antes del fetch: si alguien invalida mientras tanto, lo
+        // escrito ya nace viejo y el siguiente read lo descarta
+        const versions = await this.getTagVersions([ALL_TAG, ...(config.tags || [])]);
+        const startedAt = Date.now();
+        const data = await fetcher();
+        await this.write(key, data, config, versions, Date.now() - startedAt);
+        return data;
+      } finally {
+        inFlight.delete(fullKey);
+      }
+    })();
+    inFlight.set(fullKey, promise);
+    return promise;
   }
 
   // ═══════════════════════════════════════════════════════════════════════════
   // INVALIDATION
+  // Registro de versiones por tag en KV (cache:tagv:<tag>): invalidar sube la
+  // versión; cada isolate compara la versión con la que se escribió la
+  // entrada y descarta las viejas en su siguiente lectura. La versión leída se
+  // reusa CACHE_TAG_CHECK_MS, así que la propagación tarda a lo sumo eso (más
+  // la consistencia eventual de KV).
   // ═══════════════════════════════════════════════════════════════════════════
 
   async invalidateByTag(tag: string): Promise<number> {
+    await this.bumpTag(tag);
     let invalidated = 0;
-    for (const [key, entry] of this.memoryCache.entries()) {
-      if (entry.tags.includes(tag)) {
-        this.memoryCache.delete(key);
+    for (const [fullKey, slot] of [...this.memoryCache.entries()]) {
+      if (slot.entry.tags.includes(tag)) {
+        this.drop(fullKey);
         invalidated++;
       }
     }
+    this.stats.tagInvalidations++;
     return invalidated;
   }
 
-  invalidateAll(): void {
+  async invalidateAll(): Promise<void> {
+    await this.bumpTag(ALL_TAG);
     this.memoryCache.clear();
-    this.version++;
+    this.memoryBytes = 0;
+    this.stats.tagInvalidations++;
+  }
+
+  private async bumpTag(tag: string): Promise<number> {
+    const [current] = await this.getTagVersions([tag]);
+    const version = Math.max(Date.now(), current + 1);
+    tagVersions.set(tag, { version, checkedAt: Date.now() });
+    if (this.kv) {
+      try {
+        await this.kv.put(TAG_REGISTRY_PREFIX + tag, String(version));
+      } catch (err) {
+        console.error(`Cache tag invalidate error (${tag}):`, err);
+      }
+    }
+    return version;
+  }
+
+  private async tagsCurrent(entry: CacheEntry<any>): Promise<boolean> {
+    const tags = [ALL_TAG, ...entry.tags];
+    const versions = await this.getTagVersions(tags);
+    return tags.every((tag, i) => (entry.tagVersions?.[tag] || 0) >= versions[i]);
+  }
+
+  /** Versión vigente de cada tag: memoria si se consultó hace < CACHE_TAG_CHECK_MS, si no KV */
+  private getTagVersions(tags: string[]): Promise<number[]> {
+    return Promise.all(tags.map(tag => this.getTagVersion(tag)));
+  }
+
+  private getTagVersion(tag: string): Promise<number> {
+    const known = tagVersions.get(tag);
+    const now = Date.now();
+    if (!this.kv || (known && now - known.checkedAt < CACHE_TAG_CHECK_MS)) {
+      return Promise.resolve(known?.version || 0);
+    }
+
+    const pending = tagReads.get(tag);
+    if (pending) return pending;
+
+    const read = (async () => {
+      try {
+        const raw = await this.kv!.get(TAG_REGISTRY_PREFIX + tag);
+        const version = Math.max(raw ? parseInt(raw, 10) || 0 : 0, tagVersions.get(tag)?.version || 0);
+        tagVersions.set(tag, { version, checkedAt: Date.now() });
+        return version;
+      } catch (err) {
+        console.error(`Cache tag version error (${tag}):`, err);
+        return known?.version || 0;
+      } finally {
+        tagReads.delete(tag);
+      }
+    })();
+    tagReads.set(tag, read);
+    return read;
   }
 
   // ═══════════════════════════════════════════════════════════════════════════
@@ -204,18 +456,32 @@ export class CacheService {
   // ═══════════════════════════════════════════════════════════════════════════
 
   getStats(): CacheStats {
-    const total = this.stats.hits + this.stats.misses;
+    const total = this.stats.hits + this.stats.staleHits + this.stats.misses;
+    const perKey: Record<string, CacheKeyStats> = {};
+    for (const [key, stats] of this.keyStats) perKey[key] = { ...stats };
     return {
       hits: this.stats.hits,
       misses: this.stats.misses,
-      hitRate: total > 0 ? ((this.stats.hits / total) * 100).toFixed(1) + '%' : '0%',
+      staleHits: this.stats.staleHits,
+      revalidations: this.stats.revalidations,
+      coalesced: this.stats.coalesced,
+      earlyRefreshes: this.stats.earlyRefreshes,
+      hitRate: total > 0 ? (((this.stats.hits + this.stats.staleHits) / total) * 100).toFixed(1) + '%' : '0%',
       totalKeys: this.memoryCache.size,
+      memoryBytes: this.memoryBytes,
+      maxEntries: this.maxEntries,
+      maxBytes: this.maxBytes,
+      evictions: this.stats.evictions,
+      expired: this.stats.expired,
+      tagInvalidations: this.stats.tagInvalidations,
+      perKey,
       lastReset: this.stats.lastReset
     };
   }
 
   resetStats(): void {
-    this.stats = { hits: 0, misses: 0, lastReset: new Date().toISOString() };
+    this.stats = newStats();
+    this.keyStats.clear();
   }
 
   // ═══════════════════════════════════════════════════════════════════════════
@@ -223,28 +489,78 @@ export class CacheService {
   // ═══════════════════════════════════════════════════════════════════════════
 
   private getFullKey(key: string): string {
-    return `cache:v${this.version}:${key}`;
+    return `cache:v${CACHE_FORMAT_VERSION}:${key}`;
+  }
+
+  /** Guarda en memoria (LRU) y expulsa las más viejas hasta volver a los límites */
+  private remember(key: string, fullKey: string, entry: CacheEntry<any>, bytes: number): void {
+    this.drop(fullKey);
+    if (bytes > this.maxBytes) return; // más grande que todo el tier: solo KV
+
+    this.memoryCache.set(fullKey, { key, entry, bytes });
+    this.memoryBytes += bytes;
+    this.keyStatsFor(key).bytes = bytes;
+
+    while (this.memoryCache.size > this.maxEntries || this.memoryBytes > this.maxBytes) {
+      const oldest = this.memoryCache.keys().next().value;
+      if (oldest === undefined) break;
+      this.drop(oldest);
+      this.stats.evictions++;
+    }
+  }
+
+  private drop(fullKey: string): void {
+    const slot = this.memoryCache.get(fullKey);
+    if (!slot) return;
+    this.memoryCache.delete(fullKey);
+    this.memoryBytes -= slot.bytes;
+    const stats = this.keyStats.get(slot.key);
+    if (stats) stats.bytes = 0;
   }
 
+  private maybeSweep(now: number): void {
+    if (now - this.lastSweep < CACHE_SWEEP_INTERVAL_MS) return;
+    this.lastSweep = now;
+    this.cleanup();
+  }
+
+  private count(key: string, field: 'hits' | 'misses' | 'staleHits'): void {
+    this.stats[field]++;
+    this.keyStatsFor(key)[field]++;
+  }
+
+  private keyStatsFor(key: string): CacheKeyStats {
+    let stats = this.keyStats.get(key);
+    if (stats) {
+      this.keyStats.delete(key);
+    } else {
+      stats = { hits: 0, misses: 0, staleHits: 0, bytes: 0 };
+    }
+    this.keyStats.set(key, stats);
+    while (this.keyStats.size > CACHE_STATS_MAX_KEYS) {
+      const oldest = this.keyStats.keys().next().value;
+      if (oldest === undefined) break;
+      this.keyStats.delete(oldest);
+    }
+    return stats;
+  }
+
+  /** Saca de memoria las entradas que ya no se pueden servir (ni stale) */
   cleanup(): number {
     let cleaned = 0;
     const now = Date.now();
-    for (const [key, entry] of this.memoryCache.entries()) {
-      if (entry.expiresAt < now) {
-        this.memoryCache.delete(key);
+    for (const [fullKey, slot] of [...this.memoryCache.entries()]) {
+      if (usableUntil(slot.entry) < now) {
+        this.drop(fullKey);
         cleaned++;
       }
     }
+    this.stats.expired += cleaned;
     return cleaned;
   }
 
   getMemoryUsage(): number {
-    let size = 0;
-    for (const [key, entry] of this.memoryCache.entries()) {
-      size += key.length * 2;
-      size += JSON.stringify(entry).length * 2;
-    }
-    return size;
+    return this.memoryBytes;
   }
 
   formatStatsForWhatsApp(): string {
@@ -253,23 +569,54 @@ export class CacheService {
     let msg = '📊 *ESTADÍSTICAS DE CACHE*\n\n';
     msg += '*Rendimiento:*\n';
     msg += `• Hits: ${stats.hits}\n`;
+    msg += `• Stale (SWR): ${stats.staleHits}\n`;
     msg += `• Misses: ${stats.misses}\n`;
+    msg += `• Coalescidos: ${stats.coalesced}\n`;
+    msg += `• Refresh anticipado: ${stats.earlyRefreshes}\n`;
     msg += `• Hit Rate: ${stats.hitRate}\n\n`;
     msg += '*Memoria:*\n';
     msg += `• Keys: ${stats.totalKeys}\n`;
-    msg += `• Uso: ${memUsageKB} KB`;
+    msg += `• Uso: ${memUsageKB} KB / ${(stats.maxBytes / 1024).toFixed(0)} KB\n`;
+    msg += `• Expulsadas (LRU): ${stats.evictions}`;
     return msg;
   }
 }
 
-// Singleton
-let cacheInstance: CacheService | null = null;
+interface MemorySlot {
+  key: string;
+  entry: CacheEntry<any>;
+  bytes: number;
+}
+
+function newStats() {
+  return { hits: 0, misses: 0, staleHits: 0, revalidations: 0, coalesced: 0, earlyRefreshes: 0, evictions: 0, expired: 0, tagInvalidations: 0, lastReset: new Date().toISOString() };
+}
 
-export function getCacheService(kv?: KVNamespace): CacheService {
-  if (!cacheInstance) cacheInstance = new CacheService(kv || null);
-  return cacheInstance;
+/** Hasta cuándo se puede servir una entrada (stale incluido) */
+function usableUntil(entry: CacheEntry<any>): number {
+  return entry.staleUntil || entry.expiresAt;
+}
+
+// ═══ Instancia del isolate ═══
+// Una por binding KV: el tier en memoria (LRU, stats por key, copia stale
+// para SWR) sobrevive entre requests; cada request pone su waitUntil, como
+// el tier compartido de entityCache. El CRON envuelve el KV con el
+// SubrequestGovernor, así que obtiene su propia instancia.
+let isolateInstances = new WeakMap<object, CacheService>();
+let noKvInstance: CacheService | null = null;
+
+export function getCacheService(kv?: KVNamespace | null, waitUntil?: WaitUntilFn): CacheService {
+  let instance = kv ? isolateInstances.get(kv) : noKvInstance;
+  if (!instance) {
+    instance = new CacheService(kv || null);
+    if (kv) isolateInstances.set(kv, instance);
+    else noKvInstance = instance;
+  }
+  if (waitUntil) instance.setWaitUntil(waitUntil);
+  return instance;
 }
 
 export function resetCacheService(): void {
-  cacheInstance = null;
+  isolateInstances = new WeakMap();
+  noKvInstance = null;
 }
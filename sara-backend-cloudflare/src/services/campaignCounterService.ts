@@ -0,0 +1,137 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// CAMPAIGN COUNTER BUFFER - Contadores por campaña con escrituras agrupadas
+// ═══════════════════════════════════════════════════════════════════════════
+// El envío de broadcasts y el webhook de estados incrementan contadores en
+// memoria (sent/failed por campaña, estados por wamid, respuestas por
+// teléfono) y los escriben en campaign_counters con 1-2 RPCs por flush
+// (migración 016). Sin la migración los RPC no existen y el flush se omite;
+// los reportes de agencia caen a sus consultas sobre leads.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { SupabaseService } from './supabase';
+
+export interface CampaignCounterDelta {
+  sent?: number;
+  delivered?: number;
+  read?: number;
+  replied?: number;
+  failed?: number;
+  leads_created?: number;
+  cost?: number;
+}
+
+export interface CampaignCounterBufferOptions {
+  waitUntil?: (promise: Promise<any>) => void; // ctx.waitUntil del request/CRON
+  maxSize?: number; // Eventos pendientes antes de adelantar el flush
+}
+
+export const CAMPAIGN_COUNTER_MAX_SIZE = 50;
+export const CAMPAIGN_LOG_BATCH_SIZE = 50;
+
+const COUNTER_FIELDS: (keyof CampaignCounterDelta)[] = ['sent', 'delivered', 'read', 'replied', 'failed', 'leads_created', 'cost'];
+
+function isMissingRpc(error: any): boolean {
+  return error?.code === 'PGRST202' || error?.code === '42883' || error?.code === '42P01';
+}
+
+export class CampaignCounterBuffer {
+  private deltas: Map<string, CampaignCounterDelta> = new Map();
+  private statuses: { message_id: string; status: string }[] = [];
+  private replies: Set<string> = new Set();
+  private inFlight: Set<Promise<void>> = new Set();
+  private flushes = 0;
+  private rpcCalls = 0;
+  private maxSize: number;
+
+  constructor(private supabase: SupabaseService, private options: CampaignCounterBufferOptions = {}) {
+    this.maxSize = options.maxSize || CAMPAIGN_COUNTER_MAX_SIZE;
+  }
+
+  /** Suma deltas al contador de una campaña (síncrono, no espera I/O) */
+  bump(campaignId: string, delta: CampaignCounterDelta): void {
+    const current = this.deltas.get(campaignId) || {};
+    for (const field of COUNTER_FIELDS) {
+      if (delta[field]) current[field] = (current[field] || 0) + delta[field]!;
+    }
+    this.deltas.set(campaignId, current);
+    this.schedule();
+  }
+
+  /** Estado de entrega de un wamid; la DB lo atribuye a su campaign_log */
+  addStatus(messageId: string, status: string): void {
+    if (!messageId || !['delivered', 'read', 'failed'].includes(status)) return;
+    this.statuses.push({ message_id: messageId, status });
+    this.schedule();
+  }
+
+  /** Mensaje entrante: cuenta como respuesta al broadcast reciente de ese teléfono */
+  addReply(phone: string): void {
+    if (!phone) return;
+    this.replies.add(phone);
+    this.schedule();
+  }
+
+  getPendingCount(): number {
+    return this.deltas.size + this.statuses.length + this.replies.size;
+  }
+
+  getStats(): { pending: number; flushes: number; rpcCalls: number } {
+    return { pending: this.getPendingCount(), flushes: this.flushes, rpcCalls: this.rpcCalls };
+  }
+
+  /** Escribe lo pendiente y espera a los flush en curso */
+  async flush(): Promise<void> {
+    if (this.getPendingCount() > 0) this.track(this.flushNow());
+    while (this.inFlight.size > 0) {
+      await Promise.all(Array.from(this.inFlight));
+    }
+  }
+
+  private schedule(): void {
+    if (this.getPendingCount() >= this.maxSize) {
+      this.track(this.flushNow());
+    }
+  }
+
+  private track(promise: Promise<void>): void {
+    const tracked = promise.catch(e => console.error('📊 Campaign counters flush error:', e));
+    this.inFlight.add(tracked);
+    tracked.finally(() => this.inFlight.delete(tracked));
+    if (this.options.waitUntil) {
+      try { this.options.waitUntil(tracked); } catch { /* ctx ya cerrado */ }
+    }
+  }
+
+  private async flushNow(): Promise<void> {
+    const deltas = this.deltas;
+    const statuses = this.statuses;
+    const replies = this.replies;
+    this.deltas = new Map();
+    this.statuses = [];
+    this.replies = new Set();
+    if (deltas.size === 0 && statuses.length === 0 && replies.size === 0) return;
+
+    this.flushes++;
+    if (deltas.size > 0) {
+      const rows = Array.from(deltas.entries()).map(([campaign_id, delta]) => ({ campaign_id, ...delta }));
+      this.rpcCalls++;
+      const { error } = await this.supabase.client.rpc('bump_campaign_counters', { p_rows: rows });
+      if (error && !isMissingRpc(error)) console.error('⚠️ bump_campaign_counters error:', error.message);
+    }
+    if (statuses.length > 0 || replies.size > 0) {
+      this.rpcCalls++;
+      const { error } = await this.supabase.client.rpc('record_campaign_events', {
+        p_statuses: statuses,
+        p_phones: Array.from(replies)
+      });
+      if (error && !isMissingRpc(error)) console.error('⚠️ record_campaign_events error:', error.message);
+    }
+  }
+}
+
+export function createCampaignCounterBuffer(
+  supabase: SupabaseService,
+  options: CampaignCounterBufferOptions = {}
+): CampaignCounterBuffer {
+  return new CampaignCounterBuffer(supabase, options);
+}
@@ -8,12 +8,13 @@ import { OfferTrackingService } from './offerTrackingService';
 import { SmartAlertsService } from './smartAlertsService';
 import { MarketIntelligenceService } from './marketIntelligenceService';
 import { CustomerValueService } from './customerValueService';
-import { PDFReportService } from './pdfReportService';
 import { getLastHealthCheck, getLastAIResponses } from '../crons/healthCheck';
 import { getBackupLog } from '../crons/dashboard';
 import { getObservabilityDashboard, formatObservabilityForWhatsApp } from './observabilityService';
 import { DevelopmentFunnelService } from './developmentFunnelService';
 import { ReferralService } from './referralService';
+import { getCachedForecast, generateForecast, formatForecastForWhatsApp } from './forecastingService';
+import { CacheService } from './cacheService';
 
 export interface CEOCommandResult {
   handled: boolean;
@@ -24,7 +25,7 @@ export interface CEOCommandResult {
 }
 
 export class CEOCommandsService {
-  constructor(private supabase: SupabaseService) {}
+  constructor(private supabase: SupabaseService, private cache?: CacheService | null) {}
 
   detectCommand(mensaje: string, _body?: string, nombreCEO?: string): { action: string; message?: string; handlerName?: string; handlerParams?: any } {
     const msgLower = mensaje.toLowerCase().trim();
@@ -42,6 +43,7 @@ export class CEOCommandsService {
           `*📈 ANÁLISIS*\n` +
           `• *llamadas* - Dashboard llamadas IA\n` +
           `• *probabilidad* - Cierre\n` +
+          `• *pronóstico* - Forecast de ventas\n` +
           `• *visitas* / *alertas* / *mercado*\n` +
           `• *clv* - Valor cliente\n` +
           `• *programa referidos* - Referral program\n\n` +
@@ -177,11 +179,15 @@ export class CEOCommandsService {
     }
 
     // ═══ PROBABILIDAD DE CIERRE ═══
-    if (msgLower === 'probabilidad' || msgLower === 'probabilidades' ||
-        msgLower === 'prob cierre' || msgLower === 'pronostico' || msgLower === 'pronóstico') {
+    if (msgLower === 'probabilidad' || msgLower === 'probabilidades' || msgLower === 'prob cierre') {
       return { action: 'call_handler', handlerName: 'probabilidadCierre' };
     }
 
+    // ═══ PRONÓSTICO DE VENTAS (forecast cacheado por día) ═══
+    if (msgLower === 'pronostico' || msgLower === 'pronóstico' || msgLower === 'forecast') {
+      return { action: 'call_handler', handlerName: 'pronosticoVentas' };
+    }
+
     // ═══ GESTIÓN DE VISITAS ═══
     if (msgLower === 'visitas' || msgLower === 'visitas hoy' ||
         msgLower === 'recorridos' || msgLower === 'gestion visitas' || msgLower === 'gestión visitas') {
@@ -1055,6 +1061,14 @@ export class CEOCommandsService {
           return { message };
         }
 
+        // ═══ PRONÓSTICO DE VENTAS ═══
+        case 'pronosticoVentas': {
+          const forecast = this.cache
+            ? await getCachedForecast(this.supabase, this.cache)
+            : await generateForecast(this.supabase);
+          return { message: formatForecastForWhatsApp(forecast) };
+        }
+
         // ═══ GESTIÓN DE VISITAS ═══
         case 'gestionVisitas': {
           const visitService = new VisitManagementService(this.supabase);
@@ -1120,6 +1134,7 @@ export class CEOCommandsService {
 
         // ═══ REPORTE SEMANAL ═══
         case 'reporteSemanal': {
+          const { PDFReportService } = await import('./pdfReportService');
           const reportService = new PDFReportService(this.supabase);
           const config = reportService.getWeeklyReportConfig(nombreCEO);
           const data = await reportService.generateReportData(config);
@@ -1129,6 +1144,7 @@ export class CEOCommandsService {
 
         // ═══ REPORTE MENSUAL ═══
         case 'reporteMensual': {
+          const { PDFReportService } = await import('./pdfReportService');
           const reportService = new PDFReportService(this.supabase);
           const config = reportService.getMonthlyReportConfig(nombreCEO);
           const data = await reportService.generateReportData(config);
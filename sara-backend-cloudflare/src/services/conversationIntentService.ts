@@ -0,0 +1,118 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// CONVERSATION INTENT SERVICE - Contadores de intención/objeción
+// ═══════════════════════════════════════════════════════════════════════════
+// Clasifica cada mensaje de lead al llegar (ingest) e incrementa contadores
+// diarios en conversation_intent_counts (migración 011). /api/metrics/conversation
+// lee esos contadores en vez de descargar conversation_history de todos los leads.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { SupabaseService } from './supabase';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// TYPES
+// ═══════════════════════════════════════════════════════════════════════════
+
+export type ConversationIntent = 'saludo' | 'precio' | 'ubicacion' | 'cita' | 'credito' | 'objecion' | 'otro';
+
+export type ConversationObjection = 'muy caro' | 'no me interesa' | 'lo voy a pensar' | 'ya compré' | 'no me alcanza';
+
+export interface MessageClassification {
+  intent: ConversationIntent;
+  objections: ConversationObjection[];
+}
+
+export interface IntentCounts {
+  intenciones: Record<ConversationIntent, number>;
+  objeciones: Record<ConversationObjection, number>;
+}
+
+export function emptyIntentCounts(): IntentCounts {
+  return {
+    intenciones: { saludo: 0, precio: 0, ubicacion: 0, cita: 0, credito: 0, objecion: 0, otro: 0 },
+    objeciones: { 'muy caro': 0, 'no me interesa': 0, 'lo voy a pensar': 0, 'ya compré': 0, 'no me alcanza': 0 }
+  };
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// CLASIFICACIÓN (mismas reglas que usaba /api/metrics/conversation)
+// ═══════════════════════════════════════════════════════════════════════════
+
+export function classifyUserMessage(text: string): MessageClassification {
+  const content = (text || '').toLowerCase();
+
+  // Intención principal (primera regla que aplica)
+  let intent: ConversationIntent = 'otro';
+  if (content.match(/hola|buenos|buenas|hi|hello/)) intent = 'saludo';
+  else if (content.match(/precio|costo|cuanto|cuánto|presupuesto/)) intent = 'precio';
+  else if (content.match(/donde|ubicación|ubicacion|gps|dirección/)) intent = 'ubicacion';
+  else if (content.match(/cita|visita|ver|conocer|agendar/)) intent = 'cita';
+  else if (content.match(/crédito|credito|infonavit|fovissste|banco|financ/)) intent = 'credito';
+  else if (content.match(/caro|no me interesa|pensar|no gracias|no puedo/)) intent = 'objecion';
+
+  // Objeciones específicas (pueden ser varias)
+  const objections: ConversationObjection[] = [];
+  if (content.includes('muy caro') || content.includes('caro')) objections.push('muy caro');
+  if (content.includes('no me interesa') || content.includes('no gracias')) objections.push('no me interesa');
+  if (content.includes('pensar') || content.includes('después')) objections.push('lo voy a pensar');
+  if (content.includes('ya compré') || content.includes('ya tengo casa')) objections.push('ya compré');
+  if (content.includes('no me alcanza') || content.includes('no tengo')) objections.push('no me alcanza');
+
+  return { intent, objections };
+}
+
+/** Suma la clasificación de un mensaje a un acumulador en memoria */
+export function addClassification(counts: IntentCounts, c: MessageClassification): void {
+  counts.intenciones[c.intent]++;
+  for (const o of c.objections) counts.objeciones[o]++;
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// CONTADORES EN DB
+// ═══════════════════════════════════════════════════════════════════════════
+
+/**
+ * Incrementa los contadores del día para un mensaje entrante de lead.
+ * Un solo RPC (upsert aditivo); nunca lanza.
+ */
+export async function recordConversationIntents(supabase: SupabaseService, text: string, at: Date = new Date()): Promise<void> {
+  if (!text) return;
+  const { intent, objections } = classifyUserMessage(text);
+  const items = [
+    { kind: 'intent', label: intent, count: 1 },
+    ...objections.map(label => ({ kind: 'objection', label, count: 1 }))
+  ];
+  try {
+    const { error } = await supabase.client.rpc('increment_conversation_intents', {
+      p_day: at.toISOString().split('T')[0],
+      p_items: items
+    });
+    if (error && error.code !== 'PGRST202' && error.code !== '42883') {
+      console.error('⚠️ Error incrementando intent counters:', error.message);
+    }
+  } catch (e) {
+    console.error('⚠️ Error incrementando intent counters:', e);
+  }
+}
+
+/**
+ * Lee los contadores desde un día (inclusive).
+ * null = tabla no disponible → el caller recalcula desde los historiales.
+ */
+export async function getIntentCounts(supabase: SupabaseService, sinceDay: string): Promise<IntentCounts | null> {
+  const { data, error } = await supabase.client
+    .from('conversation_intent_counts')
+    .select('kind, label, count')
+    .gte('day', sinceDay);
+
+  if (error) return null;
+
+  const counts = emptyIntentCounts();
+  for (const row of data || []) {
+    if (row.kind === 'intent' && row.label in counts.intenciones) {
+      counts.intenciones[row.label as ConversationIntent] += Number(row.count) || 0;
+    } else if (row.kind === 'objection' && row.label in counts.objeciones) {
+      counts.objeciones[row.label as ConversationObjection] += Number(row.count) || 0;
+    }
+  }
+  return counts;
+}
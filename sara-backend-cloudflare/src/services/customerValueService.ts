@@ -150,22 +150,35 @@ export class CustomerValueService {
       referredByName = referrer?.name || null;
     }
 
-    // Calculate lifetime value
-    const purchaseValue = Number(lead.budget) || 0;
-    const lifetimeValue = purchaseValue + referralValue;
-    const potentialValue = this.calculatePotentialValue(lead, referralsMade);
-
     // Get interaction count
     const { count: interactions } = await this.supabase.client
       .from('conversation_history')
       .select('id', { count: 'exact' })
       .eq('lead_id', customerId);
 
+    return this.toProfile(lead, {
+      referralsMade,
+      referralConversions,
+      referralValue,
+      referredByName,
+      interactions: interactions || 0
+    });
+  }
+
+  private toProfile(
+    lead: any,
+    stats: { referralsMade: number; referralConversions: number; referralValue: number; referredByName: string | null; interactions: number }
+  ): CustomerProfile {
+    // Calculate lifetime value
+    const purchaseValue = Number(lead.budget) || 0;
+    const lifetimeValue = purchaseValue + stats.referralValue;
+    const potentialValue = this.calculatePotentialValue(lead, stats.referralsMade);
+
     // Determine segment
-    const segment = this.determineSegment(lead, lifetimeValue, referralsMade);
+    const segment = this.determineSegment(lead, lifetimeValue, stats.referralsMade);
 
     // Generate tags
-    const tags = this.generateTags(lead, referralsMade, lifetimeValue);
+    const tags = this.generateTags(lead, stats.referralsMade, lifetimeValue);
 
     return {
       id: lead.id,
@@ -177,12 +190,12 @@ export class CustomerValueService {
       purchase_value: purchaseValue,
       lifetime_value: lifetimeValue,
       potential_value: potentialValue,
-      referral_value: referralValue,
-      referred_by: referredByName,
-      referrals_made: referralsMade,
-      referral_conversions: referralConversions,
+      referral_value: stats.referralValue,
+      referred_by: stats.referredByName,
+      referrals_made: stats.referralsMade,
+      referral_conversions: stats.referralConversions,
       last_contact: lead.last_activity_at || lead.updated_at,
-      total_interactions: interactions || 0,
+      total_interactions: stats.interactions,
       satisfaction_score: lead.nps_score || null,
       segment,
       tags
@@ -247,7 +260,36 @@ export class CustomerValueService {
   // CLV ANALYSIS
   // ═══════════════════════════════════════════════════════════════════════════
 
+  // Una llamada a clv_summary (acumuladores de migración 015); sin la
+  // migración se reconstruye desde leads con un perfil por cliente.
   async getCLVAnalysis(): Promise<CLVAnalysis> {
+    const { data: summary, error } = await this.supabase.client.rpc('clv_summary', { p_top: 20 });
+
+    if (!error && summary) {
+      return this.buildAnalysis({
+        totalCustomers: Number(summary.total_customers) || 0,
+        totalCLV: Number(summary.total_clv) || 0,
+        profiles: (summary.customers || []).map((c: any) => this.toProfile(c, {
+          referralsMade: Number(c.referrals_made) || 0,
+          referralConversions: Number(c.referral_conversions) || 0,
+          referralValue: Number(c.referral_value) || 0,
+          referredByName: c.referred_by_name || null,
+          interactions: Number(c.total_interactions) || 0
+        })),
+        totalReferrals: Number(summary.total_referrals) || 0,
+        convertedReferrals: Number(summary.converted_referrals) || 0,
+        referralRevenue: Number(summary.referral_revenue) || 0,
+        topReferrers: summary.top_referrers || []
+      });
+    }
+
+    if (error && error.code !== 'PGRST202' && error.code !== '42883') {
+      console.error('⚠️ CLV summary error:', error.message);
+    }
+    return this.getCLVAnalysisFromLeads();
+  }
+
+  private async getCLVAnalysisFromLeads(): Promise<CLVAnalysis> {
     // Get all customers (sold/delivered)
     const { data: customers } = await this.supabase.client
       .from('leads')
@@ -267,19 +309,11 @@ export class CustomerValueService {
 
     // Calculate metrics
     const totalCLV = allCustomers.reduce((sum, c) => sum + (Number(c.budget) || 0), 0);
-    const avgCLV = allCustomers.length > 0 ? Math.round(totalCLV / allCustomers.length) : 0;
-    const avgPurchaseValue = avgCLV;
 
-    // Segment customers
-    const segments = { vip: 0, high_value: 0, medium_value: 0, new: 0, at_risk: 0, churned: 0 };
     const customerProfiles: CustomerProfile[] = [];
-
     for (const customer of allCustomers.slice(0, 20)) {
       const profile = await this.getCustomerProfile(customer.id);
-      if (profile) {
-        customerProfiles.push(profile);
-        segments[profile.segment]++;
-      }
+      if (profile) customerProfiles.push(profile);
     }
 
     // Referral analysis
@@ -325,12 +359,40 @@ export class CustomerValueService {
         value_generated: r.value
       }));
 
+    return this.buildAnalysis({
+      totalCustomers: allCustomers.length,
+      totalCLV,
+      profiles: customerProfiles,
+      totalReferrals,
+      convertedReferrals,
+      referralRevenue,
+      topReferrers
+    });
+  }
+
+  private buildAnalysis(input: {
+    totalCustomers: number;
+    totalCLV: number;
+    profiles: CustomerProfile[];
+    totalReferrals: number;
+    convertedReferrals: number;
+    referralRevenue: number;
+    topReferrers: CLVAnalysis['referrals']['top_referrers'];
+  }): CLVAnalysis {
+    const { totalCustomers, totalCLV, profiles, totalReferrals, convertedReferrals, referralRevenue, topReferrers } = input;
+    const avgCLV = totalCustomers > 0 ? Math.round(totalCLV / totalCustomers) : 0;
+    const avgPurchaseValue = avgCLV;
+
+    // Segment customers
+    const segments = { vip: 0, high_value: 0, medium_value: 0, new: 0, at_risk: 0, churned: 0 };
+    for (const profile of profiles) segments[profile.segment]++;
+
     // Retention metrics (simplified)
-    const churnRiskCount = customerProfiles.filter(c => c.segment === 'at_risk').length;
+    const churnRiskCount = profiles.filter(c => c.segment === 'at_risk').length;
 
     // Generate recommendations
     const recommendations = this.generateRecommendations(
-      allCustomers.length,
+      totalCustomers,
       avgCLV,
       totalReferrals,
       convertedReferrals,
@@ -339,7 +401,7 @@ export class CustomerValueService {
 
     return {
       generated_at: new Date().toISOString(),
-      total_customers: allCustomers.length,
+      total_customers: totalCustomers,
       total_clv: totalCLV,
       avg_clv: avgCLV,
       avg_purchase_value: avgPurchaseValue,
@@ -351,8 +413,8 @@ export class CustomerValueService {
           ? ((convertedReferrals / totalReferrals) * 100).toFixed(1) + '%'
           : '0%',
         referral_revenue: referralRevenue,
-        avg_referrals_per_customer: allCustomers.length > 0
-          ? Math.round((totalReferrals / allCustomers.length) * 10) / 10
+        avg_referrals_per_customer: totalCustomers > 0
+          ? Math.round((totalReferrals / totalCustomers) * 10) / 10
           : 0,
         top_referrers: topReferrers
       },
@@ -361,7 +423,7 @@ export class CustomerValueService {
         avg_time_to_repeat: 0,
         churn_risk_count: churnRiskCount
       },
-      top_customers: customerProfiles
+      top_customers: profiles
         .sort((a, b) => b.lifetime_value - a.lifetime_value)
         .slice(0, 10),
       recommendations
@@ -0,0 +1,257 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// DAILY METRICS SERVICE - Rollup diario para reportes
+// ═══════════════════════════════════════════════════════════════════════════
+// Lee la tabla daily_metrics (día × vendedor × desarrollo × fuente), que se
+// mantiene incrementalmente con triggers en leads/appointments (migración 010).
+// Diario / semanal / mensual son sumas de rangos de días: unas decenas de
+// filas pre-agregadas en vez de escanear leads y citas completos.
+// Si la tabla no existe todavía o el tenant no tiene marca de backfill
+// (daily_metrics_backfill), devuelve null y el reporte usa sus queries.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { SupabaseService } from './supabase';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// TYPES
+// ═══════════════════════════════════════════════════════════════════════════
+
+export interface DailyMetricsRow {
+  day: string; // YYYY-MM-DD (UTC)
+  vendedor_id: string;
+  development: string;
+  source: string;
+  leads_created: number;
+  leads_lost: number;
+  sales_closed: number;
+  revenue: number;
+  first_response_count: number;
+  first_response_minutes: number;
+  appointments_total: number;
+  appointments_completed: number;
+  appointments_no_show: number;
+  appointments_cancelled: number;
+}
+
+export interface DailyMetricsTotals {
+  leads: number;
+  lost: number;
+  sales: number;
+  revenue: number;
+  responseCount: number;
+  responseMinutes: number;
+  appointments: number;
+  appointmentsCompleted: number;
+  appointmentsNoShow: number;
+  appointmentsCancelled: number;
+}
+
+export interface DailyMetricsSummary {
+  totals: DailyMetricsTotals;
+  byVendedor: Record<string, DailyMetricsTotals>;
+  byDevelopment: Record<string, DailyMetricsTotals>;
+  bySource: Record<string, DailyMetricsTotals>;
+}
+
+// vendedor_id usado en el rollup para leads/citas sin asignar
+export const UNASSIGNED_VENDEDOR = '00000000-0000-0000-0000-000000000000';
+
+// Status que cuentan como venta. Debe coincidir con daily_metrics_lead_contrib
+// y rebuild_daily_metrics (migración 010) para que rollup y fallback cuadren.
+export const SALE_STATUSES = ['closed', 'delivered'];
+
+const ROLLUP_PAGE_SIZE = 1000;
+const DEFAULT_SALE_PRICE = 2000000; // mismo default que los reportes y la migración 010
+const METRIC_COLUMNS = 'day, vendedor_id, development, source, leads_created, leads_lost, sales_closed, revenue, first_response_count, first_response_minutes, appointments_total, appointments_completed, appointments_no_show, appointments_cancelled';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// HELPERS
+// ═══════════════════════════════════════════════════════════════════════════
+
+/** Día UTC (YYYY-MM-DD) de una fecha, mismo corte que los reportes */
+export function toDayKey(date: Date | string): string {
+  return (typeof date === 'string' ? new Date(date) : date).toISOString().split('T')[0];
+}
+
+export function emptyTotals(): DailyMetricsTotals {
+  return {
+    leads: 0,
+    lost: 0,
+    sales: 0,
+    revenue: 0,
+    responseCount: 0,
+    responseMinutes: 0,
+    appointments: 0,
+    appointmentsCompleted: 0,
+    appointmentsNoShow: 0,
+    appointmentsCancelled: 0
+  };
+}
+
+function addRow(target: DailyMetricsTotals, row: DailyMetricsRow): void {
+  target.leads += Number(row.leads_created) || 0;
+  target.lost += Number(row.leads_lost) || 0;
+  target.sales += Number(row.sales_closed) || 0;
+  target.revenue += Number(row.revenue) || 0;
+  target.responseCount += Number(row.first_response_count) || 0;
+  target.responseMinutes += Number(row.first_response_minutes) || 0;
+  target.appointments += Number(row.appointments_total) || 0;
+  target.appointmentsCompleted += Number(row.appointments_completed) || 0;
+  target.appointmentsNoShow += Number(row.appointments_no_show) || 0;
+  target.appointmentsCancelled += Number(row.appointments_cancelled) || 0;
+}
+
+function bucket(map: Record<string, DailyMetricsTotals>, key: string): DailyMetricsTotals {
+  if (!map[key]) map[key] = emptyTotals();
+  return map[key];
+}
+
+/**
+ * Suma filas del rollup (opcionalmente solo días en [fromDay, toDay]).
+ * Los días son strings YYYY-MM-DD, comparables lexicográficamente.
+ */
+export function summarizeDailyMetrics(rows: DailyMetricsRow[], fromDay?: string, toDay?: string): DailyMetricsSummary {
+  const summary: DailyMetricsSummary = { totals: emptyTotals(), byVendedor: {}, byDevelopment: {}, bySource: {} };
+
+  for (const row of rows) {
+    if (fromDay && row.day < fromDay) continue;
+    if (toDay && row.day > toDay) continue;
+
+    addRow(summary.totals, row);
+    addRow(bucket(summary.byVendedor, row.vendedor_id), row);
+    addRow(bucket(summary.byDevelopment, row.development || ''), row);
+    addRow(bucket(summary.bySource, row.source || ''), row);
+  }
+
+  return summary;
+}
+
+/**
+ * Mismos totales (global y por vendedor) calculados desde filas crudas,
+ * para cuando el rollup no está disponible. Reglas idénticas a los triggers:
+ * revenue = precio de la propiedad (2M por defecto), respuesta 0 < min < 24h.
+ */
+export function summarizeRawByVendedor(
+  leads: any[] | null | undefined,
+  sales: any[] | null | undefined,
+  appointments: any[] | null | undefined
+): Pick<DailyMetricsSummary, 'totals' | 'byVendedor'> {
+  const totals = emptyTotals();
+  const byVendedor: Record<string, DailyMetricsTotals> = {};
+  const both = (vendedorId: string | null | undefined, apply: (t: DailyMetricsTotals) => void) => {
+    apply(totals);
+    apply(bucket(byVendedor, vendedorId || UNASSIGNED_VENDEDOR));
+  };
+
+  for (const l of leads || []) {
+    let respMin = 0;
+    if (l.first_response_at && l.created_at) {
+      respMin = (new Date(l.first_response_at).getTime() - new Date(l.created_at).getTime()) / 60000;
+    }
+    both(l.assigned_to, t => {
+      t.leads++;
+      if (respMin > 0 && respMin < 1440) {
+        t.responseCount++;
+        t.responseMinutes += respMin;
+      }
+    });
+  }
+
+  for (const c of sales || []) {
+    both(c.assigned_to, t => {
+      t.sales++;
+      t.revenue += c.properties?.price || DEFAULT_SALE_PRICE;
+    });
+  }
+
+  for (const a of appointments || []) {
+    both(a.vendedor_id, t => {
+      t.appointments++;
+      if (a.status === 'completed') t.appointmentsCompleted++;
+      if (a.status === 'no_show' || a.status === 'missed') t.appointmentsNoShow++;
+      if (a.status === 'cancelled') t.appointmentsCancelled++;
+    });
+  }
+
+  return { totals, byVendedor };
+}
+
+/** Promedio de minutos de primera respuesta (0 si no hay datos) */
+export function avgResponseMinutes(totals: DailyMetricsTotals): number {
+  return totals.responseCount > 0 ? totals.responseMinutes / totals.responseCount : 0;
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// SERVICE
+// ═══════════════════════════════════════════════════════════════════════════
+
+export class DailyMetricsService {
+  constructor(private supabase: SupabaseService) {}
+
+  /**
+   * Filas del rollup entre dos días (inclusive).
+   * null = tabla no disponible (migración 010 sin aplicar) o historia sin
+   * backfill para este tenant → usar queries crudas.
+   */
+  async getRange(fromDay: string, toDay: string): Promise<DailyMetricsRow[] | null> {
+    try {
+      if (!(await this.isBackfilled())) return null;
+
+      const rows: DailyMetricsRow[] = [];
+      // Paginado: PostgREST corta en 1000 filas por respuesta
+      for (let offset = 0; ; offset += ROLLUP_PAGE_SIZE) {
+        const { data, error } = await this.supabase.client
+          .from('daily_metrics')
+          .select(METRIC_COLUMNS)
+          .gte('day', fromDay)
+          .lte('day', toDay)
+          .order('day', { ascending: true })
+          .range(offset, offset + ROLLUP_PAGE_SIZE - 1);
+
+        if (error) {
+          if (error.code !== '42P01') console.error('⚠️ daily_metrics no disponible:', error.message);
+          return null;
+        }
+        rows.push(...((data || []) as DailyMetricsRow[]));
+        if (!data || data.length < ROLLUP_PAGE_SIZE) break;
+      }
+      return rows;
+    } catch (e) {
+      console.error('⚠️ Error leyendo daily_metrics:', e);
+      return null;
+    }
+  }
+
+  /** true si el rollup del tenant ya cubre toda su historia (marca de la migración 010) */
+  private async isBackfilled(): Promise<boolean> {
+    const { data, error } = await this.supabase.client
+      .from('daily_metrics_backfill')
+      .select('backfilled_at')
+      .limit(1)
+      .maybeSingle();
+    if (error) {
+      if (error.code !== '42P01') console.error('⚠️ daily_metrics_backfill no disponible:', error.message);
+      return false;
+    }
+    return !!data;
+  }
+
+  /** Resumen de un rango, o null si el rollup no está disponible */
+  async summarize(fromDay: string, toDay: string): Promise<DailyMetricsSummary | null> {
+    const rows = await this.getRange(fromDay, toDay);
+    return rows ? summarizeDailyMetrics(rows) : null;
+  }
+
+  /** Recalcula el rollup de un rango desde las filas crudas (reconciliación) */
+  async rebuild(fromDay: string, toDay: string): Promise<number | null> {
+    const { data, error } = await this.supabase.client.rpc('rebuild_daily_metrics', { p_from: fromDay, p_to: toDay });
+    if (error) {
+      console.error('⚠️ Error en rebuild_daily_metrics:', error.message);
+      return null;
+    }
+    return typeof data === 'number' ? data : null;
+  }
+}
+
+export function createDailyMetrics(supabase: SupabaseService): DailyMetricsService {
+  return new DailyMetricsService(supabase);
+}
@@ -0,0 +1,279 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// DELIVERY STATUS BUFFER - Estados de entrega de WhatsApp en bloque
+// ═══════════════════════════════════════════════════════════════════════════
+// Un broadcast grande genera miles de callbacks sent/delivered/read. En vez
+// de KV get+put (dedup) y un upsert por estado, el buffer junta los estados,
+// se queda con el más avanzado por message_id y escribe un solo upsert
+// multi-row (RPC upsert_delivery_statuses, migración 017). El upsert es
+// monótono: read > delivered > sent, failed es terminal; un estado repetido
+// o atrasado no cambia la fila, así que no hace falta dedup en KV.
+// Solo las filas que avanzaron llegan a onApplied (tracking, TTS, campañas,
+// fallbacks 131047), de modo que los reintentos de Meta no duplican efectos.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { SupabaseService } from './supabase';
+import { MetaWhatsAppService } from './meta-whatsapp';
+
+export type DeliveryStatusType = 'sent' | 'delivered' | 'read' | 'failed';
+
+export interface DeliveryStatusRow {
+  message_id: string;
+  recipient_phone: string;
+  status: DeliveryStatusType;
+  timestamp: string | null;
+  error_code: string | null;
+  error_message: string | null;
+}
+
+export interface DeliveryStatusBufferOptions {
+  waitUntil?: (promise: Promise<any>) => void; // ctx.waitUntil del request/consumidor
+  maxSize?: number; // message_ids pendientes antes de adelantar el flush
+  onApplied?: (rows: DeliveryStatusRow[]) => Promise<void>; // filas que avanzaron de estado
+  throwOnError?: boolean; // consumidor de la cola: flush() rechaza si la escritura falló (para reintentar)
+}
+
+export const DELIVERY_STATUS_MAX_SIZE = 500;
+
+export const DELIVERY_STATUS_RANK: Record<DeliveryStatusType, number> = {
+  sent: 1,
+  delivered: 2,
+  read: 3,
+  failed: 4
+};
+
+function isMissingRpc(error: any): boolean {
+  return error?.code === 'PGRST202' || error?.code === '42883';
+}
+
+/** Convierte un status del webhook de Meta en fila de message_delivery_status */
+export function toDeliveryStatusRow(status: any): DeliveryStatusRow | null {
+  if (!status?.id || !DELIVERY_STATUS_RANK[status.status as DeliveryStatusType]) return null;
+  const errorCode = status.errors?.[0]?.code;
+  return {
+    message_id: status.id,
+    recipient_phone: status.recipient_id,
+    status: status.status,
+    timestamp: status.timestamp ? new Date(parseInt(status.timestamp) * 1000).toISOString() : null,
+    error_code: errorCode !== undefined && errorCode !== null ? String(errorCode) : null,
+    error_message: status.errors?.[0]?.title || null
+  };
+}
+
+/** ¿El estado nuevo avanza sobre el actual? */
+export function advancesStatus(current: string | null | undefined, next: string): boolean {
+  return (DELIVERY_STATUS_RANK[next as DeliveryStatusType] || 0) > (DELIVERY_STATUS_RANK[current as DeliveryStatusType] || 0);
+}
+
+export class DeliveryStatusBuffer {
+  private latest: Map<string, DeliveryStatusRow> = new Map();
+  private inFlight: Set<Promise<void>> = new Set();
+  private errors: unknown[] = [];
+  private received = 0;
+  private flushes = 0;
+  private rowsApplied = 0;
+  private maxSize: number;
+
+  constructor(private supabase: SupabaseService, private options: DeliveryStatusBufferOptions = {}) {
+    this.maxSize = options.maxSize || DELIVERY_STATUS_MAX_SIZE;
+  }
+
+  /** Agrega un status del webhook; se queda con el más avanzado por message_id */
+  add(status: any): void {
+    const row = toDeliveryStatusRow(status);
+    if (!row) return;
+    this.received++;
+    const current = this.latest.get(row.message_id);
+    if (!current || advancesStatus(current.status, row.status)) {
+      this.latest.set(row.message_id, row);
+    }
+    if (this.latest.size >= this.maxSize) {
+      this.track(this.flushNow());
+    }
+  }
+
+  getPendingCount(): number {
+    return this.latest.size;
+  }
+
+  getStats(): { pending: number; received: number; flushes: number; rowsApplied: number } {
+    return { pending: this.latest.size, received: this.received, flushes: this.flushes, rowsApplied: this.rowsApplied };
+  }
+
+  /** Escribe lo pendiente y espera a los flush en curso (con throwOnError, rechaza si alguno falló) */
+  async flush(): Promise<void> {
+    if (this.latest.size > 0) this.track(this.flushNow());
+    while (this.inFlight.size > 0) {
+      await Promise.all(Array.from(this.inFlight));
+    }
+    if (this.errors.length > 0) {
+      const [first] = this.errors;
+      this.errors = [];
+      throw first;
+    }
+  }
+
+  private track(promise: Promise<void>): void {
+    const tracked = promise.catch(e => {
+      console.error('📬 Delivery status flush error:', e);
+      if (this.options.throwOnError) this.errors.push(e);
+    });
+    this.inFlight.add(tracked);
+    tracked.finally(() => this.inFlight.delete(tracked));
+    if (this.options.waitUntil) {
+      try { this.options.waitUntil(tracked); } catch { /* ctx ya cerrado */ }
+    }
+  }
+
+  private async flushNow(): Promise<void> {
+    const rows = Array.from(this.latest.values());
+    this.latest = new Map();
+    if (rows.length === 0) return;
+
+    this.flushes++;
+    const applied = await this.upsert(rows);
+    this.rowsApplied += applied.length;
+    console.log(`📬 Delivery status: ${rows.length} message_ids → ${applied.length} avanzaron (1 upsert)`);
+    if (applied.length > 0 && this.options.onApplied) {
+      await this.options.onApplied(applied);
+    }
+  }
+
+  /** Upsert monótono; devuelve las filas que cambiaron de estado */
+  private async upsert(rows: DeliveryStatusRow[]): Promise<DeliveryStatusRow[]> {
+    const { data, error } = await this.supabase.client.rpc('upsert_delivery_statuses', { p_rows: rows });
+    if (!error) {
+      const advanced = new Set((data || []).map((r: any) => r.message_id));
+      return rows.filter(r => advanced.has(r.message_id));
+    }
+    if (!isMissingRpc(error)) {
+      console.error('⚠️ upsert_delivery_statuses error:', error.message);
+      if (this.options.throwOnError) throw new Error(`upsert_delivery_statuses: ${error.message}`);
+      return [];
+    }
+
+    // Sin migración 017: leer estados actuales y escribir solo los que avanzan
+    const { data: existing, error: readError } = await this.supabase.client
+      .from('message_delivery_status')
+      .select('message_id, status')
+      .in('message_id', rows.map(r => r.message_id));
+    if (readError) {
+      console.log(`📬 message_delivery_status no disponible (${readError.message}), solo log`);
+      // Tabla inexistente: reintentar no cambia nada; cualquier otro error sí
+      if (this.options.throwOnError && readError.code !== '42P01') throw new Error(`message_delivery_status read: ${readError.message}`);
+      return [];
+    }
+    const current = new Map((existing || []).map((r: any) => [r.message_id, r.status]));
+    const advancing = rows.filter(r => advancesStatus(current.get(r.message_id), r.status));
+    if (advancing.length === 0) return [];
+
+    const now = new Date().toISOString();
+    const { error: upsertError } = await this.supabase.client
+      .from('message_delivery_status')
+      .upsert(advancing.map(r => ({ ...r, updated_at: now })), { onConflict: 'message_id' });
+    if (upsertError) {
+      console.error('⚠️ message_delivery_status upsert error:', upsertError.message);
+      if (this.options.throwOnError) throw new Error(`message_delivery_status upsert: ${upsertError.message}`);
+      return [];
+    }
+    return advancing;
+  }
+}
+
+export function createDeliveryStatusBuffer(
+  supabase: SupabaseService,
+  options: DeliveryStatusBufferOptions = {}
+): DeliveryStatusBuffer {
+  return new DeliveryStatusBuffer(supabase, options);
+}
+
+/**
+ * 131047 = ventana de 24h cerrada. Reenvía como template (resumen_vendedor
+ * al equipo, seguimiento_lead a leads) y guarda el texto original como
+ * pending_mensaje para entregarlo cuando respondan.
+ */
+export async function sendWindowClosedFallback(
+  supabase: SupabaseService,
+  meta: MetaWhatsAppService,
+  recipientId: string,
+  messageId: string
+): Promise<void> {
+  console.log(`📱 131047 detectado para ${recipientId}, enviando template fallback...`);
+  try {
+    // Buscar contenido original en messages_sent
+    const { data: msgRow } = await supabase.client
+      .from('messages_sent')
+      .select('contenido, recipient_type, recipient_id')
+      .eq('message_id', messageId)
+      .single();
+
+    const phoneSuffix = recipientId?.slice(-10) || '';
+
+    // Determinar si es team member o lead
+    const { data: tmMatch } = await supabase.client
+      .from('team_members')
+      .select('id, name, notes')
+      .like('phone', `%${phoneSuffix}`)
+      .eq('active', true)
+      .limit(1);
+
+    if (tmMatch && tmMatch.length > 0) {
+      // ── TEAM MEMBER → resumen_vendedor + pending ──
+      const tm = tmMatch[0];
+      const nombreCorto = tm.name?.split(' ')[0] || 'Equipo';
+      await meta.sendTemplate(recipientId, 'resumen_vendedor', 'es_MX', [{
+        type: 'body',
+        parameters: [
+          { type: 'text', text: nombreCorto },
+          { type: 'text', text: '-' },
+          { type: 'text', text: '-' },
+          { type: 'text', text: '-' },
+          { type: 'text', text: '-' },
+          { type: 'text', text: 'Responde para ver tu mensaje.' }
+        ]
+      }], true);
+      // Guardar pending
+      const notes = (tm.notes && typeof tm.notes === 'object') ? { ...tm.notes } : {};
+      if (!notes.pending_mensaje) {
+        notes.pending_mensaje = {
+          texto: msgRow?.contenido || 'SARA te envió un mensaje. Responde para verlo.',
+          timestamp: new Date().toISOString(),
+          expires_at: new Date(Date.now() + 48 * 3600000).toISOString()
+        };
+        await supabase.client.from('team_members').update({ notes }).eq('id', tm.id);
+      }
+      console.log(`📱 131047 recovery OK: template resumen_vendedor → ${tm.name}`);
+    } else {
+      // ── LEAD → seguimiento_lead + pending ──
+      const { data: leadMatch } = await supabase.client
+        .from('leads')
+        .select('id, name, notes, property_interest')
+        .like('phone', `%${phoneSuffix}`)
+        .limit(1);
+      const lead = leadMatch?.[0];
+      const nombreCorto = lead?.name?.split(' ')[0] || 'Amigo';
+      const desarrollo = lead?.property_interest || 'nuestros desarrollos';
+      await meta.sendTemplate(recipientId, 'seguimiento_lead', 'es_MX', [{
+        type: 'body',
+        parameters: [
+          { type: 'text', text: nombreCorto },
+          { type: 'text', text: desarrollo }
+        ]
+      }], true);
+      // Guardar pending en lead
+      if (lead?.id) {
+        const notes = (lead.notes && typeof lead.notes === 'object') ? { ...lead.notes } : {};
+        if (!notes.pending_mensaje) {
+          notes.pending_mensaje = {
+            texto: msgRow?.contenido || 'SARA te envió un mensaje. Responde para verlo.',
+            timestamp: new Date().toISOString(),
+            expires_at: new Date(Date.now() + 48 * 3600000).toISOString()
+          };
+          await supabase.client.from('leads').update({ notes }).eq('id', lead.id);
+        }
+      }
+      console.log(`📱 131047 recovery OK: template seguimiento_lead → ${nombreCorto}`);
+    }
+  } catch (fallbackErr) {
+    console.error(`❌ 131047 template fallback error: ${(fallbackErr as Error).message}`);
+  }
+}
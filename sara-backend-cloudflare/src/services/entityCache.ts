@@ -0,0 +1,350 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// ENTITY CACHE - Identity map por request/CRON para team_members,
+// properties y tenants
+// - Scope: un EntityCache por SupabaseService (uno por request o corrida de
+//   CRON). Cada entidad se lee a lo sumo una vez por invocación; las lecturas
+//   repetidas cuestan cero subrequests. Keys por tenant (setTenant del CRON).
+// - Debajo: roster de team_members activos y catálogo de properties en
+//   CacheService (memoria del isolate + KV); tenants en el LRU de tenant.ts.
+// - Escrituras: invalidate('team' | 'properties') limpia scope, isolate y KV.
+// Las filas por id/teléfono NO pasan por isolate/KV: notes lleva la ventana
+// 24h y los pending, así que se leen de DB y solo se memoizan en el scope.
+// Quien reescribe notes de una fila del scope la actualiza con
+// patchTeamMember() para que la siguiente lectura no la pise.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { CacheService, CacheConfig, CACHE_TTLS, WaitUntilFn } from './cacheService';
+import { resolveTenantById, TenantContext } from '../middleware/tenant';
+import type { SupabaseService } from './supabase';
+
+export type EntityTag = 'team' | 'properties';
+
+type Counter = 'lookups' | 'hits' | 'shared' | 'dbFetches';
+
+export interface EntityCacheStats {
+  lookups: number;
+  hits: number;       // servidas desde el scope (cero I/O)
+  shared: number;     // servidas por isolate/KV
+  dbFetches: number;  // queries que emitió este scope
+  hitRate: string;    // hits / lookups
+}
+
+/** Últimos 10 dígitos: mismo criterio que el team check del webhook */
+export function phoneKey(phone: string | null | undefined): string {
+  return (phone || '').replace(/\D/g, '').slice(-10);
+}
+
+// Tier compartido del isolate (memoria + KV); el waitUntil lo pone cada scope
+let sharedTier: CacheService | null = null;
+
+function getSharedTier(kv: KVNamespace | null): CacheService {
+  if (!sharedTier) sharedTier = new CacheService(kv);
+  return sharedTier;
+}
+
+export function resetEntityCacheTier(): void {
+  sharedTier = null;
+  isolateTotals = { scopes: 0, lookups: 0, hits: 0, shared: 0, dbFetches: 0 };
+}
+
+// Acumulado del isolate (para /api/observability)
+let isolateTotals = { scopes: 0, lookups: 0, hits: 0, shared: 0, dbFetches: 0 };
+
+export function getEntityCacheStats(): EntityCacheStats & { scopes: number } {
+  return { scopes: isolateTotals.scopes, ...withRate(isolateTotals) };
+}
+
+function withRate(s: { lookups: number; hits: number; shared: number; dbFetches: number }): EntityCacheStats {
+  return {
+    lookups: s.lookups,
+    hits: s.hits,
+    shared: s.shared,
+    dbFetches: s.dbFetches,
+    hitRate: s.lookups > 0 ? ((s.hits / s.lookups) * 100).toFixed(1) + '%' : '0%',
+  };
+}
+
+export class EntityCache {
+  private scope = new Map<string, Promise<any>>();
+  private stats = { lookups: 0, hits: 0, shared: 0, dbFetches: 0 };
+  private reported = false;
+
+  constructor(
+    private supabase: SupabaseService,
+    private tier: CacheService | null = null
+  ) {
+    isolateTotals.scopes++;
+  }
+
+  /** Tenant actual del SupabaseService (cambia con setTenant en el CRON) */
+  private tenantKey(): string {
+    return this.supabase.getTenantId?.() || 'default';
+  }
+
+  /** Conecta el tier isolate/KV (el scope puede nacer antes de conocer env) */
+  attachTier(tier: CacheService): void {
+    if (!this.tier) this.tier = tier;
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // TEAM MEMBERS
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  /**
+   * Roster de team_members activos (select *). Un error de DB se propaga y no
+   * queda memoizado.
+   * @param fresh true: lee de DB aunque isolate/KV tenga copia (el CRON decide
+   *   ventana 24h con notes). Las filas frescas quedan en el identity map.
+   */
+  async getTeamMembers(options?: { fresh?: boolean }): Promise<any[]> {
+    const tenantId = this.tenantKey();
+    const key = `team_members:active:${tenantId}`;
+    if (options?.fresh) this.scope.delete(key);
+
+    return this.memo(key, async () => {
+      const fetcher = async () => {
+        this.count('dbFetches');
+        const { data, error } = await this.supabase.client
+          .from('team_members')
+          .select('*')
+          .eq('active', true);
+        if (error) throw new Error(error.message);
+        return data || [];
+      };
+      if (!options?.fresh) {
+        return this.throughTier(key, fetcher, { ttl: CACHE_TTLS.team_members, tags: ['team'] });
+      }
+      const data = await fetcher();
+      this.rememberTeamMembers(data);
+      return data;
+    });
+  }
+
+  /** Fila completa (notes incluido) leída de DB una vez por scope */
+  async getTeamMemberById(id: string | null | undefined): Promise<any | null> {
+    if (!id) return null;
+    const tenantId = this.tenantKey();
+    return this.memo(`team_member:id:${tenantId}:${id}`, async () => {
+      this.count('dbFetches');
+      const { data, error } = await this.supabase.client
+        .from('team_members')
+        .select('*')
+        .eq('id', id)
+        .maybeSingle();
+      if (error) console.error('⚠️ getTeamMemberById error:', error.message);
+      if (data) this.rememberTeamMembers([data]);
+      return data || null;
+    });
+  }
+
+  /** Varias filas por id: las que faltan en el scope salen en UNA query .in() */
+  async getTeamMembersByIds(ids: string[]): Promise<Map<string, any>> {
+    const tenantId = this.tenantKey();
+    const unique = Array.from(new Set(ids.filter(Boolean)));
+    const missing = unique.filter(id => !this.scope.has(`team_member:id:${tenantId}:${id}`));
+
+    if (missing.length > 0) {
+      this.count('dbFetches');
+      const batch = this.supabase.client
+        .from('team_members')
+        .select('*')
+        .in('id', missing)
+        .then(({ data, error }: any) => {
+          if (error) throw new Error(error.message);
+          this.rememberTeamMembers(data || []);
+          return new Map<string, any>((data || []).map((m: any) => [m.id, m]));
+        });
+      for (const id of missing) {
+        this.scope.set(`team_member:id:${tenantId}:${id}`, batch.then((byId: Map<string, any>) => byId.get(id) || null));
+      }
+      // Un error no queda memoizado: la siguiente lectura reintenta
+      batch.catch(() => {
+        for (const id of missing) this.scope.delete(`team_member:id:${tenantId}:${id}`);
+      });
+    }
+
+    for (const id of unique) {
+      this.count('lookups');
+      if (!missing.includes(id)) this.count('hits');
+    }
+    const rows = await Promise.all(unique.map(id => this.scope.get(`team_member:id:${tenantId}:${id}`)));
+    const byId = new Map<string, any>();
+    unique.forEach((id, i) => { if (rows[i]) byId.set(id, rows[i]); });
+    return byId;
+  }
+
+  /** Busca por los últimos 10 dígitos; el "no es team member" también se memoiza */
+  async getTeamMemberByPhone(phone: string | null | undefined): Promise<any | null> {
+    const last10 = phoneKey(phone);
+    if (!last10) return null;
+    const tenantId = this.tenantKey();
+    return this.memo(`team_member:phone:${tenantId}:${last10}`, async () => {
+      this.count('dbFetches');
+      const { data, error } = await this.supabase.client
+        .from('team_members')
+        .select('*')
+        .like('phone', `%${last10}`)
+        .limit(1);
+      if (error) console.error('⚠️ getTeamMemberByPhone error:', error.message);
+      const member = data?.[0] || null;
+      if (member) this.rememberTeamMembers([member]);
+      return member;
+    });
+  }
+
+  /**
+   * Write-through al identity map tras escribir una fila (p.ej. notes).
+   * Solo afecta filas ya leídas en este scope.
+   */
+  patchTeamMember(id: string, patch: Record<string, any>): void {
+    const tenantId = this.tenantKey();
+    const entry = this.scope.get(`team_member:id:${tenantId}:${id}`);
+    if (!entry) return;
+    entry.then(row => { if (row) Object.assign(row, patch); }).catch(() => {});
+  }
+
+  /** Indexa filas frescas de DB por id y teléfono (sin contar lookups) */
+  private rememberTeamMembers(rows: any[]): void {
+    const tenantId = this.tenantKey();
+    for (const row of rows) {
+      if (!row?.id) continue;
+      const idKey = `team_member:id:${tenantId}:${row.id}`;
+      this.scope.set(idKey, Promise.resolve(row));
+      const last10 = phoneKey(row.phone);
+      if (last10) this.scope.set(`team_member:phone:${tenantId}:${last10}`, Promise.resolve(row));
+    }
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // PROPERTIES
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  /** Catálogo completo (sin filtro active), ordenado por nombre */
+  async getProperties(): Promise<any[]> {
+    const key = `properties:all:${this.tenantKey()}`;
+    return this.memo(key, async () => {
+      try {
+        return await this.throughTier(key, async () => {
+          this.count('dbFetches');
+          const { data, error } = await this.supabase.client
+            .from('properties')
+            .select('*')
+            .order('name');
+          if (error) throw new Error(error.message);
+          console.log(`📦 Properties cargadas: ${data?.length || 0}`);
+          return data || [];
+        }, { ttl: CACHE_TTLS.properties, tags: ['properties'] });
+      } catch (err) {
+        console.error('Error getting properties:', err);
+        return [];
+      }
+    });
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // TENANTS
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  async getTenant(tenantId: string): Promise<TenantContext> {
+    return this.memo(`tenant:${tenantId}`, () => resolveTenantById(tenantId, this.supabase));
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // INVALIDATION
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  /** Llamar después de escribir team_members / properties del tenant actual */
+  async invalidate(tag: EntityTag): Promise<void> {
+    const tenantId = this.tenantKey();
+    const prefixes = tag === 'team'
+      ? [`team_members:active:${tenantId}`, `team_member:id:${tenantId}:`, `team_member:phone:${tenantId}:`]
+      : [`properties:all:${tenantId}`];
+    for (const key of [...this.scope.keys()]) {
+      if (prefixes.some(p => key.startsWith(p))) this.scope.delete(key);
+    }
+
+    if (this.tier) {
+      await this.tier.invalidateByTag(tag);
+      await this.tier.delete(tag === 'team' ? `team_members:active:${tenantId}` : `properties:all:${tenantId}`);
+    }
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // STATS
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  getStats(): EntityCacheStats {
+    return withRate(this.stats);
+  }
+
+  /** Log de hit rate de la invocación (una vez por scope) */
+  report(label: string): void {
+    if (this.reported || this.stats.lookups === 0) return;
+    this.reported = true;
+    const s = this.getStats();
+    console.log(`📇 Entity cache [${label}]: ${s.lookups} lookups, ${s.hits} scope hits (${s.hitRate}), ${s.shared} isolate/KV, ${s.dbFetches} DB`);
+  }
+
+  private memo<T>(key: string, load: () => Promise<T>): Promise<T> {
+    this.count('lookups');
+    const existing = this.scope.get(key);
+    if (existing) {
+      this.count('hits');
+      return existing;
+    }
+
+    const promise = load().catch(err => {
+      this.scope.delete(key);
+      throw err;
+    });
+    this.scope.set(key, promise);
+    return promise;
+  }
+
+  /**
+   * Isolate/KV → fetcher; cuenta como 'shared' si no hubo query. Devuelve una
+   * copia: la memoria del isolate es compartida entre requests y los handlers
+   * mutan las filas.
+   */
+  private async throughTier<T>(key: string, fetcher: () => Promise<T>, config: CacheConfig): Promise<T> {
+    if (!this.tier) return fetcher();
+    let fetched = false;
+    const data = await this.tier.getOrFetch(key, () => { fetched = true; return fetcher(); }, config);
+    if (!fetched) this.count('shared');
+    return structuredClone(data);
+  }
+
+  private count(field: Counter): void {
+    this.stats[field]++;
+    isolateTotals[field]++;
+  }
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// SCOPE POR SUPABASESERVICE
+// ═══════════════════════════════════════════════════════════════════════════
+
+const scopes = new WeakMap<SupabaseService, EntityCache>();
+
+/**
+ * EntityCache del request/CRON dueño de este SupabaseService.
+ * @param kv SARA_CACHE: conecta el tier isolate/KV (basta pasarlo una vez)
+ */
+export function getEntityCache(supabase: SupabaseService, kv?: KVNamespace | null, waitUntil?: WaitUntilFn): EntityCache {
+  let entities = scopes.get(supabase);
+  if (!entities) {
+    entities = new EntityCache(supabase);
+    scopes.set(supabase, entities);
+  }
+  if (kv) {
+    const tier = getSharedTier(kv);
+    if (waitUntil) tier.setWaitUntil(waitUntil);
+    entities.attachTier(tier);
+  }
+  return entities;
+}
+
+/** Reporta el hit rate si el scope llegó a usarse */
+export function reportEntityCache(supabase: SupabaseService | undefined, label: string): void {
+  if (supabase) scopes.get(supabase)?.report(label);
+}
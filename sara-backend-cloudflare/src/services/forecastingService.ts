@@ -2,8 +2,18 @@
 // FORECASTING SERVICE - Pipeline Revenue Forecasting
 // Calculates weighted revenue forecasts based on current pipeline status
 // ═══════════════════════════════════════════════════════════════════════════
+// Dos fases:
+// 1. Matrices (nocturno): conversión etapa→etapa y días por etapa, por
+//    cohort desarrollo|fuente, calculadas sobre el histórico de leads y
+//    guardadas en cache por día.
+// 2. Proyección (por request): una sola pasada sobre typed arrays
+//    (valor, etapa, cohort por lead) contra las matrices ya resueltas.
+// El resultado también se cachea por día: el comando "pronóstico" del CEO
+// y /api/reports/forecast leen de cache.
+// ═══════════════════════════════════════════════════════════════════════════
 
 import { SupabaseService } from './supabase';
+import { CacheService, CACHE_TTLS } from './cacheService';
 
 // ═══════════════════════════════════════════════════════════════════════════
 // TYPES
@@ -40,6 +50,24 @@ export interface MonthlyProjection {
   projected_deals: number;
 }
 
+/** Matriz de un cohort (desarrollo|fuente). Arrays planos para que sean JSON */
+export interface StageMatrix {
+  development: string;
+  source: string;
+  sample: number;          // leads del cohort en la ventana
+  reached: number[];       // leads que llegaron a cada etapa (o más allá)
+  conversion: number[];    // S×S aplanada: P(llegar a j | llegó a i), j >= i
+  days_in_stage: number[]; // días promedio en cada etapa
+}
+
+export interface ForecastMatrices {
+  day: string;             // YYYY-MM-DD (UTC) del cálculo
+  window_days: number;
+  stages: string[];
+  cohorts: Record<string, StageMatrix>;
+  generated_at: string;
+}
+
 // ═══════════════════════════════════════════════════════════════════════════
 // CONSTANTS
 // ═══════════════════════════════════════════════════════════════════════════
@@ -67,6 +95,26 @@ const STATUS_ALIASES: Record<string, string> = {
 
 const ACTIVE_STATUSES = ['new', 'contacted', 'qualified', 'scheduled', 'visit_scheduled', 'visited', 'negotiation', 'negotiating', 'reserved', 'closed', 'sold', 'delivered'];
 
+// Etapas del embudo en orden; delivered cuenta como closed en las matrices
+export const FORECAST_STAGES = ['new', 'contacted', 'qualified', 'scheduled', 'visited', 'negotiation', 'reserved', 'closed'];
+const STAGE_COUNT = FORECAST_STAGES.length;
+const CLOSED_STAGE = STAGE_COUNT - 1;
+const STAGE_INDEX: Record<string, number> = { delivered: CLOSED_STAGE };
+FORECAST_STAGES.forEach((stage, i) => { STAGE_INDEX[stage] = i; });
+
+// Estatus reportados en by_status (delivered se reporta aparte de closed)
+const REPORT_STATUSES = [...FORECAST_STAGES, 'delivered'];
+const REPORT_INDEX: Record<string, number> = {};
+REPORT_STATUSES.forEach((status, i) => { REPORT_INDEX[status] = i; });
+
+export const FORECAST_WINDOW_DAYS = 365;
+// Con menos leads en una etapa la tasa del cohort es ruido: se sube de nivel
+export const FORECAST_MIN_SAMPLE = 20;
+const FORECAST_MONTHS = 3;
+const HISTORY_PAGE_SIZE = 1000;
+const DAY_MS = 24 * 60 * 60 * 1000;
+const ANY = '*';
+
 // ═══════════════════════════════════════════════════════════════════════════
 // FUNCTIONS
 // ═══════════════════════════════════════════════════════════════════════════
@@ -102,6 +150,24 @@ export function getLeadPropertyValue(lead: any, properties: any[]): number {
   return lead.budget || 0;
 }
 
+/**
+ * Igual que getLeadPropertyValue, pero la búsqueda en properties se hace una
+ * vez por property_interest distinto (cientos de leads comparten unos pocos).
+ */
+export function createPropertyValueLookup(properties: any[]): (lead: any) => number {
+  const byInterest = new Map<string, number>();
+  return (lead: any) => {
+    const interest = (lead.property_interest || '').toLowerCase().trim();
+    if (!interest) return 0;
+    let price = byInterest.get(interest);
+    if (price === undefined) {
+      price = getLeadPropertyValue({ property_interest: interest }, properties);
+      byInterest.set(interest, price);
+    }
+    return price || lead.budget || 0;
+  };
+}
+
 /**
  * Calculate historical conversion rates from leads table.
  * Returns the ratio of leads that moved past each stage.
@@ -134,104 +200,279 @@ export async function getConversionRates(supabase: SupabaseService): Promise<Rec
   return rates;
 }
 
+// ═══════════════════════════════════════════════════════════════════════════
+// MATRICES (nocturno)
+// ═══════════════════════════════════════════════════════════════════════════
+
+function normalizeKey(value: string | null | undefined, fallback: string): string {
+  return (value || '').trim().toLowerCase() || fallback;
+}
+
+export function cohortKey(development: string, source: string): string {
+  return `${development}|${source}`;
+}
+
+function dayKey(date: Date): string {
+  return date.toISOString().split('T')[0];
+}
+
 /**
- * Main forecast function. Queries leads with properties for price data
- * and calculates pipeline revenue forecasts.
+ * Matrices por cohort a partir de leads históricos (status, fechas,
+ * property_interest, source). Sin historial de etapas, un lead cuenta como
+ * llegado a su etapa actual y a todas las anteriores; lost/inactive solo
+ * cuentan como "new". Días por etapa = edad promedio de los leads que hoy
+ * están en esa etapa (desde status_changed_at).
  */
-export async function generateForecast(supabase: SupabaseService): Promise<ForecastResult> {
-  // Fetch leads and properties in parallel
-  const [{ data: leads }, { data: properties }] = await Promise.all([
-    supabase.client.from('leads').select('id, name, status, property_interest, budget, created_at').in('status', ACTIVE_STATUSES),
-    supabase.client.from('properties').select('id, name, price_min, price_max').order('name'),
-  ]);
+export function computeStageMatrices(leads: any[], now: Date = new Date(), windowDays: number = FORECAST_WINDOW_DAYS): ForecastMatrices {
+  const acc = new Map<string, { development: string; source: string; sample: number; reached: Float64Array; dwellSum: Float64Array; dwellCount: Float64Array }>();
+  const nowMs = now.getTime();
+
+  const bucket = (development: string, source: string) => {
+    const key = cohortKey(development, source);
+    let entry = acc.get(key);
+    if (!entry) {
+      entry = {
+        development,
+        source,
+        sample: 0,
+        reached: new Float64Array(STAGE_COUNT),
+        dwellSum: new Float64Array(STAGE_COUNT),
+        dwellCount: new Float64Array(STAGE_COUNT)
+      };
+      acc.set(key, entry);
+    }
+    return entry;
+  };
 
-  const allLeads = leads || [];
-  const allProperties = properties || [];
+  for (const lead of leads) {
+    const status = STATUS_ALIASES[lead.status] || lead.status;
+    const stage = STAGE_INDEX[status];
+    const furthest = stage === undefined ? 0 : stage;
+    const development = normalizeKey(lead.property_interest, 'sin desarrollo');
+    const source = normalizeKey(lead.source, 'desconocido');
+    const since = Date.parse(lead.status_changed_at || lead.created_at);
+    const dwellDays = stage !== undefined && stage < CLOSED_STAGE && !isNaN(since) ? Math.max(0, (nowMs - since) / DAY_MS) : -1;
+
+    // Cohort exacto + niveles de respaldo (desarrollo, global)
+    for (const entry of [bucket(development, source), bucket(development, ANY), bucket(ANY, ANY)]) {
+      entry.sample++;
+      for (let s = 0; s <= furthest; s++) entry.reached[s]++;
+      if (dwellDays >= 0) {
+        entry.dwellSum[furthest] += dwellDays;
+        entry.dwellCount[furthest]++;
+      }
+    }
+  }
 
-  // --- By Status ---
-  const statusMap: Record<string, { count: number; total_value: number; weighted_value: number }> = {};
-  let totalPipelineValue = 0;
-  let weightedForecast = 0;
+  const cohorts: Record<string, StageMatrix> = {};
+  for (const [key, entry] of acc) {
+    const conversion = new Array<number>(STAGE_COUNT * STAGE_COUNT).fill(0);
+    for (let i = 0; i < STAGE_COUNT; i++) {
+      for (let j = i; j < STAGE_COUNT; j++) {
+        conversion[i * STAGE_COUNT + j] = entry.reached[i] > 0 ? entry.reached[j] / entry.reached[i] : 0;
+      }
+    }
+    cohorts[key] = {
+      development: entry.development,
+      source: entry.source,
+      sample: entry.sample,
+      reached: Array.from(entry.reached),
+      conversion,
+      days_in_stage: Array.from(entry.dwellSum, (sum, s) => entry.dwellCount[s] > 0 ? Math.round(sum / entry.dwellCount[s] * 10) / 10 : 0)
+    };
+  }
 
-  for (const lead of allLeads) {
-    const normalized = STATUS_ALIASES[lead.status] || lead.status;
-    const weight = getStatusWeight(lead.status);
-    const value = getLeadPropertyValue(lead, allProperties);
+  return {
+    day: dayKey(now),
+    window_days: windowDays,
+    stages: [...FORECAST_STAGES],
+    cohorts,
+    generated_at: now.toISOString()
+  };
+}
 
-    if (!statusMap[normalized]) {
-      statusMap[normalized] = { count: 0, total_value: 0, weighted_value: 0 };
+/** Lee el histórico (paginado) y calcula las matrices */
+export async function buildForecastMatrices(supabase: SupabaseService, now: Date = new Date()): Promise<ForecastMatrices> {
+  const since = new Date(now.getTime() - FORECAST_WINDOW_DAYS * DAY_MS).toISOString();
+  const history: any[] = [];
+  for (let offset = 0; ; offset += HISTORY_PAGE_SIZE) {
+    const { data, error } = await supabase.client
+      .from('leads')
+      .select('status, property_interest, source, created_at, status_changed_at')
+      .gte('created_at', since)
+      .order('created_at', { ascending: true })
+      .range(offset, offset + HISTORY_PAGE_SIZE - 1);
+    if (error) {
+      console.error('⚠️ Forecast: error leyendo histórico:', error.message);
+      break;
     }
-    statusMap[normalized].count += 1;
-    statusMap[normalized].total_value += value;
-    statusMap[normalized].weighted_value += value * weight;
-
-    totalPipelineValue += value;
-    weightedForecast += value * weight;
+    history.push(...(data || []));
+    if (!data || data.length < HISTORY_PAGE_SIZE) break;
   }
+  return computeStageMatrices(history, now);
+}
 
-  const by_status: ForecastByStatus[] = Object.entries(statusMap).map(([status, data]) => ({
-    status,
-    count: data.count,
-    total_value: data.total_value,
-    weight: STATUS_WEIGHTS[status] ?? 0,
-    weighted_value: data.weighted_value,
-  }));
+/** Matrices del día desde cache (las deja el cron nocturno); si faltan se calculan */
+export async function getForecastMatrices(supabase: SupabaseService, cache?: CacheService | null, now: Date = new Date()): Promise<ForecastMatrices> {
+  if (!cache) return buildForecastMatrices(supabase, now);
+  return cache.getOrFetch(
+    `forecast:matrices:${supabase.getTenantId()}:${dayKey(now)}`,
+    () => buildForecastMatrices(supabase, now),
+    { ttl: CACHE_TTLS.forecast_daily, tags: ['forecast'] }
+  );
+}
 
-  // --- By Development ---
-  const devMap: Record<string, { count: number; total_value: number; weighted_value: number }> = {};
+// ═══════════════════════════════════════════════════════════════════════════
+// PROYECCIÓN (typed arrays)
+// ═══════════════════════════════════════════════════════════════════════════
 
-  for (const lead of allLeads) {
+/**
+ * Resuelve las matrices a dos tablas planas por cohort: P(cierre | etapa) y
+ * días esperados hasta el cierre. Si el cohort tiene menos de
+ * FORECAST_MIN_SAMPLE leads en la etapa se usa desarrollo|*, luego *|*, y al
+ * final el peso fijo STATUS_WEIGHTS.
+ */
+function resolveCohortTables(matrices: ForecastMatrices, keys: string[]): { closeProb: Float64Array; daysToClose: Float64Array } {
+  const closeProb = new Float64Array(keys.length * STAGE_COUNT);
+  const daysToClose = new Float64Array(keys.length * STAGE_COUNT);
+  const global = matrices.cohorts[cohortKey(ANY, ANY)];
+
+  keys.forEach((key, c) => {
+    const development = key.slice(0, key.indexOf('|'));
+    const chain = [matrices.cohorts[key], matrices.cohorts[cohortKey(development, ANY)], global].filter(Boolean) as StageMatrix[];
+
+    for (let s = 0; s < STAGE_COUNT; s++) {
+      const i = c * STAGE_COUNT + s;
+      if (s === CLOSED_STAGE) {
+        closeProb[i] = 1;
+        continue;
+      }
+      const matrix = chain.find(m => m.reached[s] >= FORECAST_MIN_SAMPLE);
+      closeProb[i] = matrix ? matrix.conversion[s * STAGE_COUNT + CLOSED_STAGE] : STATUS_WEIGHTS[FORECAST_STAGES[s]];
+
+      // Días restantes = suma de días por etapa desde la actual hasta reserved
+      const timing = matrix || chain[chain.length - 1];
+      let days = 0;
+      if (timing) for (let k = s; k < CLOSED_STAGE; k++) days += timing.days_in_stage[k] || 0;
+      daysToClose[i] = days;
+    }
+  });
+
+  return { closeProb, daysToClose };
+}
+
+/**
+ * Proyección del pipeline activo contra las matrices. Los leads se codifican
+ * una vez a typed arrays (valor, etapa, cohort, desarrollo) y los totales,
+ * desgloses y meses salen de una sola pasada.
+ */
+export function projectForecast(leads: any[], properties: any[], matrices: ForecastMatrices, now: Date = new Date()): ForecastResult {
+  const n = leads.length;
+  const valueOf = createPropertyValueLookup(properties);
+  const values = new Float64Array(n);
+  const stages = new Uint8Array(n);
+  const statuses = new Uint8Array(n);
+  const cohorts = new Uint32Array(n);
+  const devs = new Uint32Array(n);
+  const cohortIds = new Map<string, number>();
+  const devIds = new Map<string, number>();
+
+  // ─── Codificar ───
+  for (let i = 0; i < n; i++) {
+    const lead = leads[i];
+    const status = STATUS_ALIASES[lead.status] || lead.status;
+    const key = cohortKey(normalizeKey(lead.property_interest, 'sin desarrollo'), normalizeKey(lead.source, 'desconocido'));
     const dev = (lead.property_interest || 'Sin desarrollo').trim();
-    const weight = getStatusWeight(lead.status);
-    const value = getLeadPropertyValue(lead, allProperties);
+    let c = cohortIds.get(key);
+    if (c === undefined) { c = cohortIds.size; cohortIds.set(key, c); }
+    let d = devIds.get(dev);
+    if (d === undefined) { d = devIds.size; devIds.set(dev, d); }
+
+    values[i] = valueOf(lead);
+    stages[i] = STAGE_INDEX[status] ?? 0;
+    statuses[i] = REPORT_INDEX[status] ?? 0;
+    cohorts[i] = c;
+    devs[i] = d;
+  }
+
+  const { closeProb, daysToClose } = resolveCohortTables(matrices, [...cohortIds.keys()]);
+
+  // ─── Una pasada ───
+  const statusCount = new Float64Array(REPORT_STATUSES.length);
+  const statusValue = new Float64Array(REPORT_STATUSES.length);
+  const statusWeighted = new Float64Array(REPORT_STATUSES.length);
+  const devCount = new Float64Array(devIds.size);
+  const devValue = new Float64Array(devIds.size);
+  const devWeighted = new Float64Array(devIds.size);
+  const monthDeals = new Float64Array(FORECAST_MONTHS);
+  const monthRevenue = new Float64Array(FORECAST_MONTHS);
+  const nowMs = now.getTime();
+  const monthBase = now.getFullYear() * 12 + now.getMonth();
+  let totalPipelineValue = 0;
+  let weightedForecast = 0;
+
+  for (let i = 0; i < n; i++) {
+    const cell = cohorts[i] * STAGE_COUNT + stages[i];
+    const p = closeProb[cell];
+    const value = values[i];
+    const weighted = value * p;
 
-    if (!devMap[dev]) {
-      devMap[dev] = { count: 0, total_value: 0, weighted_value: 0 };
+    totalPipelineValue += value;
+    weightedForecast += weighted;
+    statusCount[statuses[i]]++;
+    statusValue[statuses[i]] += value;
+    statusWeighted[statuses[i]] += weighted;
+    devCount[devs[i]]++;
+    devValue[devs[i]] += value;
+    devWeighted[devs[i]] += weighted;
+
+    // Los ya cerrados no entran a la proyección mensual
+    if (stages[i] === CLOSED_STAGE) continue;
+    const closeAt = new Date(nowMs + daysToClose[cell] * DAY_MS);
+    const month = closeAt.getFullYear() * 12 + closeAt.getMonth() - monthBase;
+    if (month < FORECAST_MONTHS) {
+      monthDeals[month] += p;
+      monthRevenue[month] += weighted;
     }
-    devMap[dev].count += 1;
-    devMap[dev].total_value += value;
-    devMap[dev].weighted_value += value * weight;
   }
 
-  const by_development: ForecastByDevelopment[] = Object.entries(devMap)
-    .map(([development, data]) => ({
+  // ─── Armar resultado ───
+  const by_status: ForecastByStatus[] = [];
+  REPORT_STATUSES.forEach((status, s) => {
+    if (statusCount[s] === 0) return;
+    by_status.push({
+      status,
+      count: statusCount[s],
+      total_value: statusValue[s],
+      weight: statusValue[s] > 0 ? statusWeighted[s] / statusValue[s] : STATUS_WEIGHTS[status] ?? 0,
+      weighted_value: statusWeighted[s],
+    });
+  });
+
+  const by_development: ForecastByDevelopment[] = [...devIds.entries()]
+    .map(([development, d]) => ({
       development,
-      count: data.count,
-      total_value: data.total_value,
-      weighted_value: data.weighted_value,
+      count: devCount[d],
+      total_value: devValue[d],
+      weighted_value: devWeighted[d],
     }))
     .sort((a, b) => b.weighted_value - a.weighted_value);
 
-  // --- Monthly Projection (next 3 months) ---
-  const conversionRates = await getConversionRates(supabase);
-  const closeRate = conversionRates['closed'] || 0.05;
-  const activeLeads = allLeads.filter(l => {
-    const n = STATUS_ALIASES[l.status] || l.status;
-    return !['closed', 'delivered', 'lost', 'inactive'].includes(n);
-  });
-  const avgDealValue = activeLeads.length > 0
-    ? activeLeads.reduce((sum, l) => sum + getLeadPropertyValue(l, allProperties), 0) / activeLeads.length
-    : 0;
-
+  // Mes actual + 2 siguientes, según la fecha esperada de cierre de cada lead
   const monthly_projection: MonthlyProjection[] = [];
-  const now = new Date();
-  for (let i = 1; i <= 3; i++) {
-    const d = new Date(now.getFullYear(), now.getMonth() + i, 1);
-    const month = `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}`;
-    // Projected deals = active leads * close rate, spread across 3 months
-    const projectedDeals = Math.round(activeLeads.length * closeRate / 3);
+  for (let m = 0; m < FORECAST_MONTHS; m++) {
+    const d = new Date(now.getFullYear(), now.getMonth() + m, 1);
     monthly_projection.push({
-      month,
-      projected_revenue: Math.round(projectedDeals * avgDealValue),
-      projected_deals: projectedDeals,
+      month: `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}`,
+      projected_revenue: Math.round(monthRevenue[m]),
+      projected_deals: Math.round(monthDeals[m]),
     });
   }
 
   // --- Confidence ---
-  const totalActive = allLeads.length;
-  const confidence: 'low' | 'medium' | 'high' = totalActive >= 20
+  const confidence: 'low' | 'medium' | 'high' = n >= 20
     ? 'high'
-    : totalActive >= 10
+    : n >= 10
       ? 'medium'
       : 'low';
 
@@ -245,3 +486,78 @@ export async function generateForecast(supabase: SupabaseService): Promise<Forec
     generated_at: new Date().toISOString(),
   };
 }
+
+// ═══════════════════════════════════════════════════════════════════════════
+// ENTRY POINTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+/**
+ * Main forecast function. Queries the active pipeline and properties and
+ * projects them against the day's matrices (from cache when available).
+ */
+export async function generateForecast(
+  supabase: SupabaseService,
+  options: { cache?: CacheService | null; matrices?: ForecastMatrices; now?: Date } = {}
+): Promise<ForecastResult> {
+  const now = options.now || new Date();
+  const [{ data: leads }, { data: properties }, matrices] = await Promise.all([
+    supabase.client.from('leads').select('id, name, status, property_interest, source, budget, created_at').in('status', ACTIVE_STATUSES),
+    supabase.client.from('properties').select('id, name, price_min, price_max').order('name'),
+    options.matrices ? Promise.resolve(options.matrices) : getForecastMatrices(supabase, options.cache, now),
+  ]);
+
+  return projectForecast(leads || [], properties || [], matrices, now);
+}
+
+/** Forecast del día desde cache (CEO "pronóstico" y /api/reports/forecast) */
+export async function getCachedForecast(supabase: SupabaseService, cache: CacheService, now: Date = new Date()): Promise<ForecastResult> {
+  return cache.getOrFetch(
+    `forecast:${supabase.getTenantId()}:${dayKey(now)}`,
+    () => generateForecast(supabase, { cache, now }),
+    { ttl: CACHE_TTLS.forecast_daily, tags: ['forecast'] }
+  );
+}
+
+/** Cron nocturno: recalcula matrices y forecast del día y los deja en cache */
+export async function precomputeForecast(supabase: SupabaseService, cache: CacheService, now: Date = new Date()): Promise<ForecastResult> {
+  const tenantId = supabase.getTenantId();
+  const matrices = await buildForecastMatrices(supabase, now);
+  await cache.set(`forecast:matrices:${tenantId}:${dayKey(now)}`, matrices, { ttl: CACHE_TTLS.forecast_daily, tags: ['forecast'] });
+  const forecast = await generateForecast(supabase, { matrices, now });
+  await cache.set(`forecast:${tenantId}:${dayKey(now)}`, forecast, { ttl: CACHE_TTLS.forecast_daily, tags: ['forecast'] });
+  return forecast;
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// WHATSAPP FORMAT
+// ═══════════════════════════════════════════════════════════════════════════
+
+function formatMillions(value: number): string {
+  return `$${(value / 1_000_000).toFixed(1)}M`;
+}
+
+export function formatForecastForWhatsApp(forecast: ForecastResult): string {
+  const lines: string[] = [];
+  lines.push('🔮 *PRONÓSTICO DE VENTAS*');
+  lines.push('');
+  lines.push(`• Pipeline: *${formatMillions(forecast.total_pipeline_value)}*`);
+  lines.push(`• Ponderado: *${formatMillions(forecast.weighted_forecast)}*`);
+  lines.push(`• Confianza: ${forecast.confidence}`);
+
+  lines.push('');
+  lines.push('📅 *Proyección por mes:*');
+  for (const m of forecast.monthly_projection) {
+    lines.push(`• ${m.month}: ${m.projected_deals} cierres → ${formatMillions(m.projected_revenue)}`);
+  }
+
+  const topDevs = forecast.by_development.slice(0, 5);
+  if (topDevs.length > 0) {
+    lines.push('');
+    lines.push('🏘️ *Top desarrollos:*');
+    for (const d of topDevs) {
+      lines.push(`• ${d.development}: ${d.count} leads → ${formatMillions(d.weighted_value)}`);
+    }
+  }
+
+  return lines.join('\n');
+}
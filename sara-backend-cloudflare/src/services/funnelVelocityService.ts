@@ -99,6 +99,15 @@ function periodStartDate(period: 'week' | 'month' | 'quarter'): Date {
   }
 }
 
+function round1(value: number): number {
+  return Math.round(value * 10) / 10;
+}
+
+// lead_stage_events / funnel_velocity_summary (migración 015) sin aplicar
+function isMissingEventLog(error: any): boolean {
+  return !!error && ['PGRST202', '42883', '42P01', 'PGRST205'].includes(error.code);
+}
+
 function periodLabel(period: 'week' | 'month' | 'quarter'): string {
   switch (period) {
     case 'week': return 'Última semana';
@@ -116,6 +125,8 @@ export class FunnelVelocityService {
 
   // ─────────────────────────────────────────────────────────────────────
   // Record a stage transition (call on every status change)
+  // El trigger de leads ya registró el evento en lead_stage_events; aquí
+  // solo se etiqueta quién lo disparó. Sin migración 015 se guarda en notes.
   // ─────────────────────────────────────────────────────────────────────
   async recordTransition(
     leadId: string,
@@ -124,6 +135,20 @@ export class FunnelVelocityService {
     triggeredBy: string
   ): Promise<void> {
     try {
+      const recent = new Date(Date.now() - 5 * 60 * 1000).toISOString();
+      const { error: tagError } = await this.supabase.client
+        .from('lead_stage_events')
+        .update({ triggered_by: triggeredBy })
+        .eq('lead_id', leadId)
+        .is('triggered_by', null)
+        .gte('changed_at', recent);
+
+      if (!tagError) return;
+      if (!isMissingEventLog(tagError)) {
+        console.error('⚠️ FunnelVelocity tag event error:', tagError.message);
+        return;
+      }
+
       // Fresh read to avoid JSONB race condition
       const lead = await this.supabase.getLeadById(leadId);
       if (!lead) {
@@ -154,10 +179,56 @@ export class FunnelVelocityService {
 
   // ─────────────────────────────────────────────────────────────────────
   // Calculate velocity metrics for a period
+  // Lee los agregados del event log (una llamada); sin migración 015
+  // re-escanea leads + notes.stage_transitions.
   // ─────────────────────────────────────────────────────────────────────
   async calculateVelocity(period: 'week' | 'month' | 'quarter'): Promise<VelocityReport> {
     const startDate = periodStartDate(period);
 
+    const { data: summary, error } = await this.supabase.client
+      .rpc('funnel_velocity_summary', { p_since: startDate.toISOString() });
+
+    if (error || !summary) {
+      if (error && !isMissingEventLog(error)) {
+        console.error('⚠️ FunnelVelocity summary error:', error.message);
+      }
+      return this.calculateVelocityFromLeads(period, startDate);
+    }
+
+    const stages: StageVelocity[] = FUNNEL_STAGES.map((stage) => {
+      const row = (summary.stages || []).find((s: any) => s.stage === stage);
+      const exits = Number(row?.exits) || 0;
+      return {
+        stage,
+        avgDaysInStage: round1(Number(row?.avg_days) || 0),
+        medianDaysInStage: round1(Number(row?.median_days) || 0),
+        leadsCurrentlyInStage: Number(summary.current?.[stage]) || 0,
+        conversionRateToNext: exits > 0 ? Math.round(((Number(row.advanced) || 0) / exits) * 100) : 0,
+      };
+    });
+
+    const vendorRows: any[] = summary.vendors || [];
+    const teamMap = vendorRows.length > 0 ? await this.getTeamNames() : new Map<string, string>();
+    const vendorAvgs = vendorRows.map((v) => ({
+      name: teamMap.get(v.assigned_to) || v.assigned_to,
+      avgDays: round1(Number(v.avg_days) || 0),
+    }));
+
+    return this.buildReport(period, stages, round1(Number(summary.close?.avg_days) || 0), vendorAvgs);
+  }
+
+  private async getTeamNames(): Promise<Map<string, string>> {
+    const { data: teamMembers } = await this.supabase.client
+      .from('team_members')
+      .select('id, name')
+      .eq('active', true);
+
+    return new Map<string, string>(
+      (teamMembers || []).map((t: any) => [t.id, t.name])
+    );
+  }
+
+  private async calculateVelocityFromLeads(period: 'week' | 'month' | 'quarter', startDate: Date): Promise<VelocityReport> {
     // Fetch leads updated/created in the period
     const { data: leads, error } = await this.supabase.client
       .from('leads')
@@ -171,14 +242,7 @@ export class FunnelVelocityService {
     const allLeads = leads || [];
 
     // Fetch team members for vendor names
-    const { data: teamMembers } = await this.supabase.client
-      .from('team_members')
-      .select('id, name')
-      .eq('active', true);
-
-    const teamMap = new Map<string, string>(
-      (teamMembers || []).map((t: any) => [t.id, t.name])
-    );
+    const teamMap = await this.getTeamNames();
 
     // ── Collect time-in-stage data ──
     // Map: stage → array of durations (days)
@@ -283,13 +347,34 @@ export class FunnelVelocityService {
 
       return {
         stage,
-        avgDaysInStage: Math.round(avg * 10) / 10,
-        medianDaysInStage: Math.round(med * 10) / 10,
+        avgDaysInStage: round1(avg),
+        medianDaysInStage: round1(med),
         leadsCurrentlyInStage: stageCounts[stage] || 0,
         conversionRateToNext: Math.round(convRate),
       };
     });
 
+    // ── Overall avg days to close ──
+    const overallAvg = closeDays.length > 0
+      ? round1(closeDays.reduce((a, b) => a + b, 0) / closeDays.length)
+      : 0;
+
+    const vendorAvgs = Object.entries(vendorCloseDays)
+      .filter(([, days]) => days.length > 0)
+      .map(([vendorId, days]) => ({
+        name: teamMap.get(vendorId) || vendorId,
+        avgDays: round1(days.reduce((a, b) => a + b, 0) / days.length),
+      }));
+
+    return this.buildReport(period, stages, overallAvg, vendorAvgs);
+  }
+
+  private buildReport(
+    period: 'week' | 'month' | 'quarter',
+    stages: StageVelocity[],
+    overallAvg: number,
+    vendorAvgs: Array<{ name: string; avgDays: number }>
+  ): VelocityReport {
     // ── Find bottleneck (longest avg, exclude delivered) ──
     const activeStages = stages.filter(
       (s) => s.stage !== 'delivered' && s.stage !== 'closed' && s.avgDaysInStage > 0
@@ -298,22 +383,11 @@ export class FunnelVelocityService {
       ? activeStages.reduce((max, s) => (s.avgDaysInStage > max.avgDaysInStage ? s : max)).stage
       : 'N/A';
 
-    // ── Overall avg days to close ──
-    const overallAvg = closeDays.length > 0
-      ? Math.round((closeDays.reduce((a, b) => a + b, 0) / closeDays.length) * 10) / 10
-      : 0;
-
     // ── Fastest / slowest vendedor ──
     let fastestVendedor: { name: string; avgDays: number } | null = null;
     let slowestVendedor: { name: string; avgDays: number } | null = null;
 
-    const vendorAvgs = Object.entries(vendorCloseDays)
-      .filter(([, days]) => days.length > 0)
-      .map(([vendorId, days]) => ({
-        name: teamMap.get(vendorId) || vendorId,
-        avgDays: Math.round((days.reduce((a, b) => a + b, 0) / days.length) * 10) / 10,
-      }))
-      .sort((a, b) => a.avgDays - b.avgDays);
+    vendorAvgs.sort((a, b) => a.avgDays - b.avgDays);
 
     if (vendorAvgs.length > 0) {
       fastestVendedor = vendorAvgs[0];
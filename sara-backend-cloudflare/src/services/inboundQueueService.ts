@@ -0,0 +1,235 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// INBOUND QUEUE - Ingesta ack-first del webhook de Meta
+// ═══════════════════════════════════════════════════════════════════════════
+// El webhook valida la firma, parte el body en eventos (uno por mensaje, los
+// estados juntos), los encola y responde 200 en milisegundos. Meta reintenta
+// los webhooks lentos, así que procesar antes de responder multiplicaba la
+// carga justo cuando íbamos más lentos.
+//
+// - META_INBOUND_QUEUE (Cloudflare Queues): cola durable; el consumidor es
+//   el handler queue() del worker.
+// - META_ACK_FIRST='true' sin binding: cola en memoria del isolate que drena
+//   con ctx.waitUntil (dev local / staging).
+// - Ninguno: el webhook procesa en línea como antes.
+//
+// El consumidor procesa los mensajes de cada lead en orden (cadena por
+// teléfono dentro del isolate) y todos los estados del batch en bloque.
+// Devuelve los eventos cuyo handler lanzó, para que queue() los reintente
+// (message.retry()) en vez de darlos por procesados.
+// ═══════════════════════════════════════════════════════════════════════════
+
+export interface InboundEvent {
+  kind: 'message' | 'statuses';
+  key: string;        // teléfono del remitente, o 'statuses'
+  receivedAt: number; // ms epoch en que llegó el webhook
+  value: any;         // value del webhook con UN mensaje, o con los estados
+}
+
+export interface InboundHandlers {
+  onMessage(value: any): Promise<void>;
+  onStatuses(value: any): Promise<void>;
+}
+
+export interface InboundQueue {
+  send(events: InboundEvent[]): Promise<void>;
+}
+
+export type InboundStage = 'ack' | 'queue_wait' | 'statuses' | 'message';
+
+export interface InboundStageStats {
+  count: number;
+  avgMs: number;
+  maxMs: number;
+}
+
+// ═══ Métricas por etapa (isolate) ═══
+const stageTimings: Map<InboundStage, { count: number; totalMs: number; maxMs: number }> = new Map();
+let enqueued = 0;
+let consumed = 0;
+
+export function recordIngestLatency(stage: InboundStage, ms: number): void {
+  const t = stageTimings.get(stage) || { count: 0, totalMs: 0, maxMs: 0 };
+  t.count++;
+  t.totalMs += ms;
+  if (ms > t.maxMs) t.maxMs = ms;
+  stageTimings.set(stage, t);
+}
+
+export function getInboundStats(): { enqueued: number; consumed: number; stages: Record<string, InboundStageStats> } {
+  const stages: Record<string, InboundStageStats> = {};
+  for (const [stage, t] of stageTimings) {
+    stages[stage] = { count: t.count, avgMs: t.count > 0 ? Math.round(t.totalMs / t.count) : 0, maxMs: t.maxMs };
+  }
+  return { enqueued, consumed, stages };
+}
+
+export function resetInboundStats(): void {
+  stageTimings.clear();
+  enqueued = 0;
+  consumed = 0;
+}
+
+/**
+ * Parte un body del webhook en eventos. Cada mensaje va solo (con los
+ * contacts/metadata de su change); los estados de un change van juntos.
+ */
+export function splitMetaWebhook(body: any, receivedAt: number = Date.now()): InboundEvent[] {
+  const events: InboundEvent[] = [];
+  for (const entry of body?.entry || []) {
+    for (const change of entry?.changes || []) {
+      const value = change?.value;
+      if (!value) continue;
+      const { messages, statuses, ...rest } = value;
+      if (statuses && statuses.length > 0) {
+        events.push({ kind: 'statuses', key: 'statuses', receivedAt, value: { ...rest, statuses } });
+      }
+      for (const message of messages || []) {
+        events.push({ kind: 'message', key: message.from || 'unknown', receivedAt, value: { ...rest, messages: [message] } });
+      }
+    }
+  }
+  return events;
+}
+
+/** Reconstruye el body del webhook para un value (formato que espera el procesador) */
+export function toWebhookBody(value: any): any {
+  return { object: 'whatsapp_business_account', entry: [{ changes: [{ field: 'messages', value }] }] };
+}
+
+// Última tarea por lead: el siguiente mensaje del mismo teléfono espera a que termine
+const leadChains: Map<string, Promise<void>> = new Map();
+
+/**
+ * Procesa un batch: estados en una sola llamada (mezclados por metadata
+ * del primero) y mensajes en orden por lead, leads distintos en paralelo.
+ * Devuelve los eventos fallidos (a reintentar); el resto quedó procesado.
+ */
+export async function consumeInboundEvents(events: InboundEvent[], handlers: InboundHandlers): Promise<InboundEvent[]> {
+  const started = Date.now();
+  const statusEvents: InboundEvent[] = [];
+  const statusList: any[] = [];
+  let statusValue: any = null;
+  const byLead: Map<string, InboundEvent[]> = new Map();
+
+  for (const event of events) {
+    recordIngestLatency('queue_wait', started - event.receivedAt);
+    if (event.kind === 'statuses') {
+      if (!statusValue) statusValue = event.value;
+      statusEvents.push(event);
+      statusList.push(...(event.value?.statuses || []));
+    } else {
+      const list = byLead.get(event.key) || [];
+      list.push(event);
+      byLead.set(event.key, list);
+    }
+  }
+
+  const work: Promise<InboundEvent[]>[] = [];
+  if (statusList.length > 0) {
+    work.push((async () => {
+      const t = Date.now();
+      let failed: InboundEvent[] = [];
+      try {
+        await handlers.onStatuses({ ...statusValue, statuses: statusList });
+      } catch (e) {
+        console.error('📥 Inbound statuses error:', e);
+        failed = statusEvents;
+      }
+      recordIngestLatency('statuses', Date.now() - t);
+      return failed;
+    })());
+  }
+  for (const [key, list] of byLead) {
+    work.push(chainLead(key, list, handlers));
+  }
+  const failed = (await Promise.all(work)).flat();
+  consumed += events.length - failed.length;
+  return failed;
+}
+
+/**
+ * Mensajes de un lead en orden. Si uno falla, él y los siguientes del mismo
+ * lead se devuelven para reintento (no se procesan fuera de orden).
+ */
+function chainLead(key: string, list: InboundEvent[], handlers: InboundHandlers): Promise<InboundEvent[]> {
+  const previous = leadChains.get(key) || Promise.resolve();
+  const next = previous.then(async () => {
+    for (let i = 0; i < list.length; i++) {
+      const t = Date.now();
+      try {
+        await handlers.onMessage(list[i].value);
+      } catch (e) {
+        console.error(`📥 Inbound message error (${key}):`, e);
+        recordIngestLatency('message', Date.now() - t);
+        return list.slice(i);
+      }
+      recordIngestLatency('message', Date.now() - t);
+    }
+    return [];
+  });
+  const done = next.then(() => {});
+  leadChains.set(key, done);
+  done.finally(() => {
+    if (leadChains.get(key) === done) leadChains.delete(key);
+  });
+  return next;
+}
+
+/** Productor sobre Cloudflare Queues (durable, reintentos de la plataforma) */
+export class CloudflareInboundQueue implements InboundQueue {
+  constructor(private queue: Queue<InboundEvent>) {}
+
+  async send(events: InboundEvent[]): Promise<void> {
+    if (events.length === 0) return;
+    await this.queue.sendBatch(events.map(body => ({ body })));
+    enqueued += events.length;
+  }
+}
+
+// Reintentos en el isolate para la cola en memoria: Meta ya recibió 200 y
+// el dedup KV se limpió, así que nadie más va a reenviar el evento.
+export const MEMORY_INBOUND_MAX_ATTEMPTS = 3;
+export const MEMORY_INBOUND_RETRY_MS = 500;
+
+/** Stand-in en memoria: responde y consume después con waitUntil */
+export class MemoryInboundQueue implements InboundQueue {
+  constructor(
+    private consume: (events: InboundEvent[]) => Promise<InboundEvent[] | void>,
+    private waitUntil?: (promise: Promise<any>) => void,
+    private retryDelayMs: number = MEMORY_INBOUND_RETRY_MS
+  ) {}
+
+  async send(events: InboundEvent[]): Promise<void> {
+    if (events.length === 0) return;
+    enqueued += events.length;
+    const drain = this.drain(events).catch(e => console.error('📥 Inbound drain error:', e));
+    if (this.waitUntil) this.waitUntil(drain);
+    else await drain;
+  }
+
+  /** Consume y reintenta los fallidos con backoff lineal, hasta MEMORY_INBOUND_MAX_ATTEMPTS */
+  private async drain(events: InboundEvent[]): Promise<void> {
+    let pending = events;
+    for (let attempt = 1; ; attempt++) {
+      const failed = (await this.consume(pending)) || [];
+      if (failed.length === 0) return;
+      if (attempt >= MEMORY_INBOUND_MAX_ATTEMPTS) {
+        console.error(`📥 Inbound: ${failed.length} evento(s) descartados tras ${attempt} intentos: ${failed.map(e => e.key).join(', ')}`);
+        return;
+      }
+      pending = failed;
+      await new Promise(r => setTimeout(r, this.retryDelayMs * attempt));
+    }
+  }
+}
+
+/** Cola según bindings; null = procesar en línea */
+export function createInboundQueue(
+  env: { META_INBOUND_QUEUE?: Queue<any>; META_ACK_FIRST?: string },
+  consume: (events: InboundEvent[]) => Promise<InboundEvent[] | void>,
+  waitUntil?: (promise: Promise<any>) => void
+): InboundQueue | null {
+  if (env.META_INBOUND_QUEUE) return new CloudflareInboundQueue(env.META_INBOUND_QUEUE);
+  if (env.META_ACK_FIRST === 'true') return new MemoryInboundQueue(consume, waitUntil);
+  return null;
+}
@@ -0,0 +1,379 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// INCREMENTAL BACKUP SERVICE - Backups de solo-cambios con manifest en R2
+// ═══════════════════════════════════════════════════════════════════════════
+// Por tabla y tenant se guarda en R2:
+//   backups/incremental/<tenant>/<tabla>/manifest.json
+//   backups/incremental/<tenant>/<tabla>/snapshot-<ts>.jsonl.gz
+//   backups/incremental/<tenant>/<tabla>/delta-<ts>.jsonl.gz
+// Cada corrida exporta solo filas con updated_at > watermark del manifest
+// (migración 012 mantiene updated_at con trigger). Cada N segmentos se
+// compactan snapshot + deltas en un snapshot nuevo (merge por id, sin tocar
+// la base). Restore = snapshot + deltas en orden, upsert por id.
+// Los leads sí se borran físicamente (con sus citas): un trigger AFTER DELETE
+// deja un tombstone (backup_tombstones, migración 012) que el delta exporta
+// como { id, _deleted: true }; compactar lo quita del snapshot y restore
+// borra esa fila.
+// ═══════════════════════════════════════════════════════════════════════════
+
+import { SupabaseService } from './supabase';
+import {
+  keysetRowStream,
+  uploadRowsToR2,
+  readJsonlFromR2,
+  deleteR2Keys,
+  StreamUploadResult
+} from './backupStreamService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// TYPES
+// ═══════════════════════════════════════════════════════════════════════════
+
+export interface BackupSegment {
+  key: string;
+  rows: number;
+  bytes: number;
+  storedBytes: number;
+  watermark: string; // updated_at máximo incluido (límite superior de la corrida)
+  created_at: string;
+}
+
+export interface BackupManifest {
+  version: 1;
+  tenant_id: string;
+  table: string;
+  watermark: string | null;
+  snapshot: BackupSegment | null;
+  segments: BackupSegment[];
+  updated_at: string;
+}
+
+export interface TableBackupResult {
+  table: string;
+  mode: 'snapshot' | 'delta' | 'noop';
+  rows: number;
+  bytes: number;
+  storedBytes: number;
+  compacted: boolean;
+  deletedKeys: number;
+  error?: string;
+}
+
+export interface RestoreResult {
+  table: string;
+  files: number;
+  rows: number;
+  upserted: number;
+  deleted: number;
+  dryRun: boolean;
+}
+
+export const INCREMENTAL_BACKUP_TABLES = ['leads', 'appointments', 'team_members', 'properties', 'followup_rules'];
+
+// Tras 7 deltas (una semana de corridas nocturnas) se compacta
+export const COMPACT_AFTER_SEGMENTS = 7;
+// El watermark sale del reloj del Worker, pero updated_at es now() de la base
+// (inicio de la transacción): una fila puede quedar con updated_at < watermark
+// y confirmarse después de la corrida. Cada delta relee desde watermark − margen;
+// las filas repetidas no importan (compact y restore hacen upsert por id).
+export const WATERMARK_MARGIN_MS = 5 * 60 * 1000;
+const RESTORE_BATCH_SIZE = 500;
+const TOMBSTONE_TABLE = 'backup_tombstones';
+
+/** Fila de delta que marca un borrado */
+export function isTombstone(row: any): boolean {
+  return row?._deleted === true;
+}
+
+/** Concatena streams en orden */
+function concatStreams(streams: ReadableStream<any>[]): ReadableStream<any> {
+  let index = 0;
+  let reader: ReadableStreamDefaultReader<any> | null = null;
+  return new ReadableStream<any>({
+    async pull(controller) {
+      while (index < streams.length) {
+        if (!reader) reader = streams[index].getReader();
+        const { value, done } = await reader.read();
+        if (!done) {
+          controller.enqueue(value);
+          return;
+        }
+        reader = null;
+        index++;
+      }
+      controller.close();
+    }
+  }, { highWaterMark: 0 });
+}
+
+/** Mapea cada fila de un stream */
+function mapStream(stream: ReadableStream<any>, fn: (row: any) => any): ReadableStream<any> {
+  const reader = stream.getReader();
+  return new ReadableStream<any>({
+    async pull(controller) {
+      const { value, done } = await reader.read();
+      if (done) controller.close();
+      else controller.enqueue(fn(value));
+    }
+  }, { highWaterMark: 0 });
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// SERVICE
+// ═══════════════════════════════════════════════════════════════════════════
+
+export class IncrementalBackupService {
+  constructor(
+    private supabase: SupabaseService,
+    private r2: R2Bucket,
+    private options: { compactAfter?: number; pageSize?: number; partSize?: number; watermarkMarginMs?: number } = {}
+  ) {}
+
+  private prefix(table: string): string {
+    return `backups/incremental/${this.supabase.getTenantId()}/${table}`;
+  }
+
+  private manifestKey(table: string): string {
+    return `${this.prefix(table)}/manifest.json`;
+  }
+
+  async getManifest(table: string): Promise<BackupManifest> {
+    const object = await this.r2.get(this.manifestKey(table));
+    if (object) return await object.json<BackupManifest>();
+    return {
+      version: 1,
+      tenant_id: this.supabase.getTenantId(),
+      table,
+      watermark: null,
+      snapshot: null,
+      segments: [],
+      updated_at: new Date().toISOString()
+    };
+  }
+
+  private async putManifest(manifest: BackupManifest): Promise<void> {
+    manifest.updated_at = new Date().toISOString();
+    await this.r2.put(this.manifestKey(manifest.table), JSON.stringify(manifest), {
+      httpMetadata: { contentType: 'application/json' }
+    });
+  }
+
+  private toSegment(result: StreamUploadResult, watermark: string): BackupSegment {
+    return {
+      key: result.key,
+      rows: result.rows,
+      bytes: result.bytes,
+      storedBytes: result.storedBytes,
+      watermark,
+      created_at: new Date().toISOString()
+    };
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // BACKUP
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  /**
+   * Una corrida para una tabla: snapshot completo si no hay manifest (o se
+   * fuerza), si no solo el delta desde el watermark; compacta al llegar a N.
+   */
+  async backupTable(table: string, options: { now?: Date; forceSnapshot?: boolean } = {}): Promise<TableBackupResult> {
+    const manifest = await this.getManifest(table);
+    const upTo = (options.now || new Date()).toISOString();
+    const stamp = upTo.replace(/[:.]/g, '-');
+    const streamOptions = { gzip: true, partSize: this.options.partSize };
+    const pageSize = this.options.pageSize;
+    // Keyset por id: una fila que cambia durante la corrida sale del filtro
+    // (updated_at > upTo) sin desplazar las páginas; entra en el próximo delta
+    const page = (query: any, afterId: string | null, limit: number) =>
+      (afterId ? query.gt('id', afterId) : query).order('id', { ascending: true }).limit(limit);
+
+    if (!manifest.snapshot || options.forceSnapshot) {
+      const obsolete = [manifest.snapshot?.key, ...manifest.segments.map(s => s.key)].filter(Boolean) as string[];
+      const rows = keysetRowStream((afterId, limit) =>
+        page(this.supabase.client.from(table).select('*').lte('updated_at', upTo), afterId, limit), pageSize);
+      const result = await uploadRowsToR2(this.r2, `${this.prefix(table)}/snapshot-${stamp}.jsonl.gz`, rows, streamOptions);
+      manifest.snapshot = this.toSegment(result, upTo);
+      manifest.segments = [];
+      manifest.watermark = upTo;
+      await this.putManifest(manifest);
+      const deletedKeys = await deleteR2Keys(this.r2, obsolete);
+      return { table, mode: 'snapshot', rows: result.rows, bytes: result.bytes, storedBytes: result.storedBytes, compacted: false, deletedKeys };
+    }
+
+    const margin = this.options.watermarkMarginMs ?? WATERMARK_MARGIN_MS;
+    const since = new Date(new Date(manifest.watermark!).getTime() - margin).toISOString();
+    const changed = keysetRowStream((afterId, limit) =>
+      page(this.supabase.client.from(table).select('*').gt('updated_at', since).lte('updated_at', upTo), afterId, limit), pageSize);
+    // Borrados de la misma ventana, después de las filas vivas
+    const deleted = keysetRowStream((afterId, limit) =>
+      page(this.supabase.client.from(TOMBSTONE_TABLE).select('id').eq('table_name', table).gt('deleted_at', since).lte('deleted_at', upTo), afterId, limit), pageSize);
+    const rows = concatStreams([changed, mapStream(deleted, (t: any) => ({ id: t.id, _deleted: true }))]);
+    const result = await uploadRowsToR2(this.r2, `${this.prefix(table)}/delta-${stamp}.jsonl.gz`, rows, streamOptions);
+
+    if (result.rows === 0) {
+      // Sin cambios: no se guarda segmento vacío, solo avanza el watermark
+      await deleteR2Keys(this.r2, [result.key]);
+    } else {
+      manifest.segments.push(this.toSegment(result, upTo));
+    }
+    manifest.watermark = upTo;
+
+    let compacted = false;
+    let deletedKeys = 0;
+    if (manifest.segments.length >= (this.options.compactAfter || COMPACT_AFTER_SEGMENTS)) {
+      deletedKeys = await this.compact(manifest, stamp);
+      compacted = true;
+    } else {
+      await this.putManifest(manifest);
+    }
+
+    return {
+      table,
+      mode: result.rows === 0 ? 'noop' : 'delta',
+      rows: result.rows,
+      bytes: result.bytes,
+      storedBytes: result.storedBytes,
+      compacted,
+      deletedKeys
+    };
+  }
+
+  /**
+   * Snapshot + deltas → snapshot nuevo. Los deltas (churn de unos días) se
+   * cargan en un Map por id; el snapshot se recorre en streaming. Un
+   * tombstone saca la fila del snapshot nuevo.
+   * Devuelve cuántos objetos viejos se borraron.
+   */
+  async compact(manifest: BackupManifest, stamp: string): Promise<number> {
+    const latest = new Map<string, any>();
+    for (const segment of manifest.segments) {
+      const rows = await readJsonlFromR2(this.r2, segment.key);
+      if (!rows) throw new Error(`Segmento faltante: ${segment.key}`);
+      const reader = rows.getReader();
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        latest.set(String(value.id), value);
+      }
+    }
+
+    const base = manifest.snapshot ? await readJsonlFromR2(this.r2, manifest.snapshot.key) : null;
+    const baseReader = base ? base.getReader() : null;
+    let remaining: IterableIterator<any> | null = null;
+    const merged = new ReadableStream<any>({
+      async pull(controller) {
+        for (;;) {
+          if (baseReader) {
+            const { value, done } = await baseReader.read();
+            if (!done) {
+              const id = String(value.id);
+              const changed = latest.get(id);
+              if (changed) latest.delete(id);
+              if (isTombstone(changed)) continue;
+              controller.enqueue(changed || value);
+              return;
+            }
+          }
+          // Filas nuevas (no estaban en el snapshot)
+          if (!remaining) remaining = latest.values();
+          const next = remaining.next();
+          if (next.done) {
+            controller.close();
+            return;
+          }
+          if (isTombstone(next.value)) continue;
+          controller.enqueue(next.value);
+          return;
+        }
+      }
+    }, { highWaterMark: 0 });
+
+    const result = await uploadRowsToR2(this.r2, `${this.prefix(manifest.table)}/snapshot-${stamp}.jsonl.gz`, merged, {
+      gzip: true,
+      partSize: this.options.partSize
+    });
+
+    const obsolete = [manifest.snapshot?.key, ...manifest.segments.map(s => s.key)].filter(Boolean) as string[];
+    manifest.snapshot = this.toSegment(result, manifest.watermark || new Date().toISOString());
+    manifest.segments = [];
+    // Primero el manifest nuevo, luego borrar: un fallo a la mitad no deja referencias rotas
+    await this.putManifest(manifest);
+    return deleteR2Keys(this.r2, obsolete);
+  }
+
+  /** Corre todas las tablas; un error en una no detiene las demás */
+  async run(tables: string[] = INCREMENTAL_BACKUP_TABLES, options: { now?: Date; forceSnapshot?: boolean } = {}): Promise<TableBackupResult[]> {
+    const results: TableBackupResult[] = [];
+    for (const table of tables) {
+      try {
+        results.push(await this.backupTable(table, options));
+      } catch (e) {
+        console.error(`❌ Backup incremental ${table}:`, e);
+        results.push({ table, mode: 'noop', rows: 0, bytes: 0, storedBytes: 0, compacted: false, deletedKeys: 0, error: String(e) });
+      }
+    }
+    return results;
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // RESTORE
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  /** Archivos a reproducir, en orden: snapshot y luego deltas */
+  async restorePlan(table: string): Promise<string[]> {
+    const manifest = await this.getManifest(table);
+    return [manifest.snapshot?.key, ...manifest.segments.map(s => s.key)].filter(Boolean) as string[];
+  }
+
+  /**
+   * Reproduce snapshot + deltas con upsert por id (lo más reciente gana);
+   * los tombstones borran la fila. dryRun solo cuenta filas.
+   */
+  async restoreTable(table: string, options: { dryRun?: boolean } = {}): Promise<RestoreResult> {
+    const dryRun = options.dryRun !== false;
+    const files = await this.restorePlan(table);
+    let rows = 0;
+    let upserted = 0;
+    let deleted = 0;
+    let batch: any[] = [];
+    let deletes: string[] = [];
+
+    // Upserts antes que borrados: el orden entre archivos lo da el loop
+    const flush = async () => {
+      if (batch.length > 0 && !dryRun) {
+        const { error } = await this.supabase.client.from(table).upsert(batch, { onConflict: 'id' });
+        if (error) throw new Error(`Restore ${table}: ${error.message}`);
+        upserted += batch.length;
+      }
+      if (deletes.length > 0 && !dryRun) {
+        const { error } = await this.supabase.client.from(table).delete().in('id', deletes);
+        if (error) throw new Error(`Restore ${table} (borrados): ${error.message}`);
+        deleted += deletes.length;
+      }
+      batch = [];
+      deletes = [];
+    };
+
+    for (const key of files) {
+      const stream = await readJsonlFromR2(this.r2, key);
+      if (!stream) throw new Error(`Archivo de backup faltante: ${key}`);
+      const reader = stream.getReader();
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        rows++;
+        if (isTombstone(value)) deletes.push(value.id);
+        else batch.push(value);
+        if (batch.length + deletes.length >= RESTORE_BATCH_SIZE) await flush();
+      }
+      // Cada archivo cierra su lote: un delta nunca comparte upsert con el snapshot
+      await flush();
+    }
+
+    return { table, files: files.length, rows, upserted, deleted, dryRun };
+  }
+}
+
+export function createIncrementalBackup(supabase: SupabaseService, r2: R2Bucket): IncrementalBackupService {
+  return new IncrementalBackupService(supabase, r2);
+}
@@ -16,8 +16,10 @@
  */
 
 import { SupabaseService } from './supabase';
-import { MetaWhatsAppService } from './meta-whatsapp';
+import { MetaWhatsAppService, SendManyJob } from './meta-whatsapp';
+import { computeNextRetryAt } from './retryQueueService';
 import { safeJsonParse } from '../utils/safeHelpers';
+import { getEntityCache } from './entityCache';
 
 // Tipos para el sistema de cola
 export interface QueuedMessage {
@@ -37,6 +39,8 @@ export interface QueuedMessage {
   template_sent_at: string | null;
   delivered_at: string | null;
   expires_at: string | null;
+  locked_until?: string | null; // lease del drainer (migración 019)
+  locked_by?: string | null;
 }
 
 export type MessageType =
@@ -68,6 +72,31 @@ export interface DeliveryResult {
   error?: string;
 }
 
+export interface EnqueueManyItem {
+  teamMemberId: string;
+  messageType: MessageType;
+  messageContent: string;
+  options?: EnqueueOptions;
+}
+
+export interface DrainResult {
+  processed: number;
+  delivered: number;     // Ventana abierta → enviado directo
+  templateSent: number;  // Template enviado → esperando respuesta
+  rescheduled: number;   // Falló, vuelve con backoff
+  failed: number;        // Agotó reintentos
+  expired: number;
+}
+
+// Mensajes 'queued' que el drainer toma por corrida
+export const QUEUE_DRAIN_BATCH = 25;
+// Lease del claim: menor al intervalo del drainer (4 min)
+export const QUEUE_LEASE_SECONDS = 180;
+// Base del backoff para reintentos de la cola (2m, 4m, 8m...)
+const QUEUE_RETRY_BASE_MS = 2 * 60 * 1000;
+// Las transiciones del drainer sueltan el lease del claim
+const RELEASE_LEASE = { locked_until: null, locked_by: null };
+
 // Configuración por tipo de mensaje
 const MESSAGE_TYPE_CONFIG: Record<MessageType, { expirationHours: number; priority: number; templateName: string }> = {
   briefing: { expirationHours: 18, priority: 1, templateName: 'resumen_vendedor' },
@@ -83,10 +112,10 @@ export class MessageQueueService {
   private meta: MetaWhatsAppService;
   private useNewQueue: boolean;
 
-  constructor(supabase: SupabaseService, meta: MetaWhatsAppService, useNewQueue = false) {
+  constructor(supabase: SupabaseService, meta: MetaWhatsAppService, useNewQueue = true) {
     this.supabase = supabase;
     this.meta = meta;
-    this.useNewQueue = useNewQueue; // Feature flag para migración gradual
+    this.useNewQueue = useNewQueue; // false = sistema legacy (pending en notes)
   }
 
   /**
@@ -99,99 +128,272 @@ export class MessageQueueService {
     messageContent: string,
     options?: EnqueueOptions
   ): Promise<DeliveryResult> {
-    const config = MESSAGE_TYPE_CONFIG[messageType] || MESSAGE_TYPE_CONFIG.notificacion;
+    const [result] = await this.enqueueMany([{ teamMemberId, messageType, messageContent, options }]);
+    return result;
+  }
+
+  /**
+   * Encola varios mensajes en lote:
+   * 1. Una sola query trae la ventana 24h de todos los destinatarios
+   * 2. Decide directo / template / cola en memoria
+   * 3. Envía con meta.sendMany (orden por destinatario, bajo rate limit global)
+   * 4. Un solo insert multi-row a message_queue (y otro a la auditoría)
+   * Un destinatario con ventana cerrada recibe UN template aunque tenga varios mensajes.
+   *
+   * Nota: los briefings/recaps del CRON todavía salen por enviarMensajeTeamMember
+   * (pending en notes), porque la entrega de message_queue al responder el
+   * vendedor (getNextPendingMessage) aún no está conectada al handler de entrada.
+   */
+  async enqueueMany(items: EnqueueManyItem[]): Promise<DeliveryResult[]> {
+    const results: DeliveryResult[] = new Array(items.length);
+    if (items.length === 0) return results;
 
     try {
-      // 1. Obtener info del team member
-      const { data: teamMember, error: tmError } = await this.supabase.client
-        .from('team_members')
-        .select('id, name, phone, notes')
-        .eq('id', teamMemberId)
-        .single();
-
-      if (tmError || !teamMember) {
-        console.error(`❌ [MQ] Team member no encontrado: ${teamMemberId}`);
-        return { success: false, method: 'failed', error: 'Team member not found' };
+      // 1. Estado de ventana de todos los destinatarios (1 query; 0 si ya se leyeron en este request/CRON)
+      let byId: Map<string, any>;
+      try {
+        byId = await getEntityCache(this.supabase).getTeamMembersByIds(items.map(i => i.teamMemberId));
+      } catch (tmError: any) {
+        console.error(`❌ [MQ] Error cargando team members:`, tmError);
+        return items.map(() => ({ success: false, method: 'failed' as const, error: tmError.message }));
       }
 
-      // 2. Verificar ventana 24h
-      const notes = safeJsonParse(teamMember.notes);
-
-      const lastInteraction = notes.last_sara_interaction;
-      const hace24h = new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString();
-      const ventanaAbierta = lastInteraction && lastInteraction > hace24h;
-
-      console.log(`📬 [MQ] ${teamMember.name}: Encolando ${messageType} (ventana: ${ventanaAbierta ? 'ABIERTA' : 'CERRADA'})`);
+      const needsTemplate = new Map<string, number[]>(); // team_member_id → índices de items
+      const addTemplate = (memberId: string, index: number) => {
+        const list = needsTemplate.get(memberId);
+        if (list) list.push(index);
+        else needsTemplate.set(memberId, [index]);
+      };
 
-      // 3. Si ventana abierta, intentar envío directo
-      if (ventanaAbierta) {
-        try {
-          await this.meta.sendWhatsAppMessage(teamMember.phone, messageContent);
-          console.log(`   ✅ [MQ] Enviado DIRECTO a ${teamMember.name}`);
+      // 2. Decidir en memoria
+      const directIdx: number[] = [];
+      items.forEach((item, index) => {
+        const tm = byId.get(item.teamMemberId);
+        if (!tm) {
+          console.error(`❌ [MQ] Team member no encontrado: ${item.teamMemberId}`);
+          results[index] = { success: false, method: 'failed', error: 'Team member not found' };
+          return;
+        }
+        const abierta = this.isWindowOpen(tm);
+        console.log(`📬 [MQ] ${tm.name}: Encolando ${item.messageType} (ventana: ${abierta ? 'ABIERTA' : 'CERRADA'})`);
+        if (abierta) directIdx.push(index);
+        else addTemplate(tm.id, index);
+      });
+
+      const auditRows: Array<{ message_id: string | null; event: string; details: Record<string, any> }> = [];
+
+      // 3a. Ventana abierta → envío directo
+      if (directIdx.length > 0) {
+        const outcomes = await this.meta.sendMany(directIdx.map(index => ({
+          to: byId.get(items[index].teamMemberId).phone,
+          text: items[index].messageContent
+        })));
+        outcomes.forEach((outcome, k) => {
+          const index = directIdx[k];
+          const item = items[index];
+          if (outcome.ok) {
+            console.log(`   ✅ [MQ] Enviado DIRECTO a ${byId.get(item.teamMemberId).name}`);
+            results[index] = { success: true, method: 'direct' };
+            auditRows.push({ message_id: null, event: 'direct_sent', details: { team_member_id: item.teamMemberId, message_type: item.messageType, method: 'direct' } });
+          } else {
+            console.log(`   ⚠️ [MQ] Envío directo falló: ${outcome.error}`);
+            addTemplate(item.teamMemberId, index); // Template como fallback
+          }
+        });
+      }
 
-          // Registrar en auditoría (si usamos nuevo sistema)
+      // 3b. Ventana cerrada (o directo falló) → un template por destinatario
+      const templateMembers = Array.from(needsTemplate.keys());
+      const templateOutcomes = templateMembers.length > 0
+        ? await this.meta.sendMany(templateMembers.map(memberId =>
+            this.buildTemplateJob(byId.get(memberId), items[needsTemplate.get(memberId)![0]].messageType)))
+        : [];
+
+      // 4. Filas para la cola (template_sent = esperan respuesta, queued = las toma el drainer)
+      const queueRows: any[] = [];
+      const queueRowIdx: number[] = [];
+      const legacyPending = new Map<string, Array<{ item: EnqueueManyItem }>>();
+
+      templateOutcomes.forEach((outcome, k) => {
+        const memberId = templateMembers[k];
+        const tm = byId.get(memberId);
+        if (outcome.ok) console.log(`   📨 [MQ] Template enviado a ${tm.name}`);
+        else console.error(`   ❌ [MQ] Template también falló: ${outcome.error}`);
+
+        for (const index of needsTemplate.get(memberId)!) {
+          const item = items[index];
           if (this.useNewQueue) {
-            await this.logAudit(null, 'direct_sent', {
-              team_member_id: teamMemberId,
-              message_type: messageType,
-              method: 'direct',
-            });
+            queueRows.push(this.buildQueueRow(tm, item, outcome.ok ? 'template_sent' : 'queued', outcome.error));
+            queueRowIdx.push(index);
+            results[index] = outcome.ok
+              ? { success: true, method: 'template' }
+              : { success: false, method: 'queued', error: outcome.error };
+          } else if (outcome.ok) {
+            const list = legacyPending.get(memberId) || [];
+            list.push({ item });
+            legacyPending.set(memberId, list);
+            results[index] = { success: true, method: 'template' };
+          } else {
+            results[index] = { success: false, method: 'failed', error: outcome.error };
           }
+        }
+      });
 
-          return { success: true, method: 'direct' };
-        } catch (directError: any) {
-          console.log(`   ⚠️ [MQ] Envío directo falló: ${directError?.message}`);
-          // Continuar con template como fallback
+      if (queueRows.length > 0) {
+        const { data: inserted, error: insertError } = await this.supabase.client
+          .from('message_queue')
+          .insert(queueRows)
+          .select('id');
+
+        if (insertError) {
+          console.error(`❌ [MQ] Error insertando en cola:`, insertError);
+        } else {
+          (inserted || []).forEach((row: any, k: number) => {
+            const index = queueRowIdx[k];
+            results[index] = { ...results[index], messageId: row.id };
+            auditRows.push({
+              message_id: row.id,
+              event: 'created',
+              details: { message_type: queueRows[k].message_type, status: queueRows[k].status, expires_at: queueRows[k].expires_at }
+            });
+          });
         }
       }
 
-      // 4. Ventana cerrada o envío directo falló → Enviar template
-      const nombreCorto = teamMember.name?.split(' ')[0] || 'Hola';
+      // Sistema legacy: un update de notes por destinatario (no por mensaje)
+      for (const [memberId, pendings] of legacyPending) {
+        await this.savePendingToNotes(byId.get(memberId), pendings.map(p => ({ messageType: p.item.messageType, messageContent: p.item.messageContent })));
+      }
 
-      try {
-        await this.meta.sendTemplate(teamMember.phone, config.templateName, 'es_MX', [
-          { type: 'body', parameters: [{ type: 'text', text: nombreCorto }] }
-        ]);
-        console.log(`   📨 [MQ] Template enviado a ${teamMember.name}`);
-      } catch (templateError: any) {
-        console.error(`   ❌ [MQ] Template también falló: ${templateError?.message}`);
-
-        // Si usa nuevo sistema, encolar para reintento
-        if (this.useNewQueue) {
-          const messageId = await this.insertToQueue(
-            teamMember,
-            messageType,
-            messageContent,
-            'queued',
-            options
-          );
-          return { success: false, method: 'queued', messageId, error: templateError?.message };
-        }
+      if (this.useNewQueue && auditRows.length > 0) {
+        await this.logAuditMany(auditRows);
+      }
+
+      return results;
 
-        return { success: false, method: 'failed', error: templateError?.message };
+    } catch (error: any) {
+      console.error(`❌ [MQ] Error en enqueueMany:`, error);
+      for (let i = 0; i < items.length; i++) {
+        if (!results[i]) results[i] = { success: false, method: 'failed', error: error?.message };
       }
+      return results;
+    }
+  }
 
-      // 5. Template enviado → Guardar mensaje como pendiente
-      if (this.useNewQueue) {
-        // Nuevo sistema: usar tabla message_queue
-        const messageId = await this.insertToQueue(
-          teamMember,
-          messageType,
-          messageContent,
-          'template_sent',
-          options
-        );
-        return { success: true, method: 'template', messageId };
+  /**
+   * Drainer: reintenta mensajes 'queued' (template falló) por prioridad.
+   * Usa idx_mq_drain (status, priority, next_retry_at). Llamar desde CRON.
+   */
+  async drainQueue(limit: number = QUEUE_DRAIN_BATCH): Promise<DrainResult> {
+    const result: DrainResult = { processed: 0, delivered: 0, templateSent: 0, rescheduled: 0, failed: 0, expired: 0 };
+    if (!this.useNewQueue) return result;
+
+    // Claim con lease (FOR UPDATE SKIP LOCKED): dos drains traslapados nunca
+    // reciben la misma fila, así que ningún mensaje sale dos veces
+    const nowIso = new Date().toISOString();
+    const { data: rows, error } = await this.supabase.client.rpc('claim_message_queue', {
+      p_worker: crypto.randomUUID(),
+      p_limit: limit,
+      p_lease_seconds: QUEUE_LEASE_SECONDS
+    });
+
+    if (error) {
+      // PGRST202 / 42883 = función no existe: sin claim no es seguro enviar
+      if (error.code === 'PGRST202' || error.code === '42883') {
+        console.warn('⚠️ [MQ] claim_message_queue no existe (aplicar migración 019), drain omitido');
+      } else if (error.code !== '42P01') {
+        console.error(`❌ [MQ] Error reclamando cola:`, error);
+      }
+      return result;
+    }
+    if (!rows || rows.length === 0) return result;
+
+    const updates: any[] = [];
+    const auditRows: Array<{ message_id: string | null; event: string; details: Record<string, any> }> = [];
+    const live: QueuedMessage[] = [];
+
+    for (const row of rows as QueuedMessage[]) {
+      if (row.expires_at && row.expires_at < nowIso) {
+        updates.push({ ...row, ...RELEASE_LEASE, status: 'expired' });
+        auditRows.push({ message_id: row.id, event: 'expired', details: {} });
+        result.expired++;
       } else {
-        // Sistema legacy: guardar en notes
-        await this.savePendingToNotes(teamMember, messageType, messageContent);
-        return { success: true, method: 'template' };
+        live.push(row);
       }
+    }
 
-    } catch (error: any) {
-      console.error(`❌ [MQ] Error en enqueue:`, error);
-      return { success: false, method: 'failed', error: error?.message };
+    if (live.length > 0) {
+      // Ventana 24h de todos los destinatarios (1 query)
+      const byId = await getEntityCache(this.supabase)
+        .getTeamMembersByIds(live.map(r => r.team_member_id))
+        .catch(() => new Map<string, any>());
+
+      // Directo para ventana abierta; un template por destinatario con ventana cerrada
+      const jobs: SendManyJob[] = [];
+      const jobRows: QueuedMessage[][] = [];
+      const templateJobByMember = new Map<string, number>();
+      for (const row of live) {
+        const tm = byId.get(row.team_member_id) || { id: row.team_member_id, name: row.team_member_name, phone: row.team_member_phone };
+        if (this.isWindowOpen(tm)) {
+          jobs.push({ to: tm.phone, text: row.message_content });
+          jobRows.push([row]);
+        } else if (templateJobByMember.has(tm.id)) {
+          jobRows[templateJobByMember.get(tm.id)!].push(row);
+        } else {
+          templateJobByMember.set(tm.id, jobs.length);
+          jobs.push(this.buildTemplateJob(tm, row.message_type));
+          jobRows.push([row]);
+        }
+      }
+
+      const outcomes = await this.meta.sendMany(jobs);
+      const now = Date.now();
+      outcomes.forEach((outcome, k) => {
+        const isTemplate = !!jobs[k].template;
+        for (const row of jobRows[k]) {
+          result.processed++;
+          if (outcome.ok && !isTemplate) {
+            updates.push({ ...row, ...RELEASE_LEASE, status: 'delivered', delivered_at: new Date(now).toISOString(), last_error: null });
+            auditRows.push({ message_id: row.id, event: 'direct_sent', details: { retry_count: row.retry_count } });
+            result.delivered++;
+          } else if (outcome.ok) {
+            updates.push({ ...row, ...RELEASE_LEASE, status: 'template_sent', template_sent_at: new Date(now).toISOString(), last_error: null });
+            auditRows.push({ message_id: row.id, event: 'template_sent', details: { retry_count: row.retry_count } });
+            result.templateSent++;
+          } else {
+            const retryCount = (row.retry_count || 0) + 1;
+            const exhausted = retryCount >= (row.max_retries || 3);
+            updates.push({
+              ...row,
+              ...RELEASE_LEASE,
+              status: exhausted ? 'failed' : 'queued',
+              retry_count: retryCount,
+              next_retry_at: exhausted ? row.next_retry_at : computeNextRetryAt(retryCount, now, Math.random, QUEUE_RETRY_BASE_MS),
+              last_error: (outcome.error || '').substring(0, 500)
+            });
+            auditRows.push({ message_id: row.id, event: exhausted ? 'template_failed' : 'retry_scheduled', details: { error: outcome.error, retry_count: retryCount } });
+            if (exhausted) result.failed++;
+            else result.rescheduled++;
+          }
+        }
+      });
     }
+
+    // Todas las transiciones en un statement (filas completas: upsert por id)
+    if (updates.length > 0) {
+      const { error: upsertError } = await this.supabase.client
+        .from('message_queue')
+        .upsert(updates, { onConflict: 'id' });
+      if (upsertError) console.error(`❌ [MQ] Error actualizando cola:`, upsertError);
+    }
+    if (auditRows.length > 0) {
+      await this.logAuditMany(auditRows);
+    }
+
+    if (result.processed > 0 || result.expired > 0) {
+      console.log(`📬 [MQ] Drain: ${result.delivered} directos, ${result.templateSent} templates, ${result.rescheduled} reprogramados, ${result.failed} fallidos, ${result.expired} expirados`);
+    }
+    return result;
   }
 
   /**
@@ -313,10 +515,8 @@ export class MessageQueueService {
     if (count > 0) {
       console.log(`🗑️ [MQ] Expirados ${count} mensajes`);
 
-      // Registrar en auditoría
-      for (const msg of data || []) {
-        await this.logAudit(msg.id, 'expired', {});
-      }
+      // Registrar en auditoría (un insert)
+      await this.logAuditMany((data || []).map((msg: any) => ({ message_id: msg.id, event: 'expired', details: {} })));
     }
 
     return count;
@@ -369,49 +569,55 @@ export class MessageQueueService {
   // ═══════════════════════════════════════════════════════════════════════════
 
   /**
-   * Inserta mensaje en la tabla message_queue
+   * Ventana 24h abierta si SARA interactuó con el team member en las últimas 24h
    */
-  private async insertToQueue(
-    teamMember: any,
-    messageType: MessageType,
-    messageContent: string,
-    status: MessageStatus,
-    options?: EnqueueOptions
-  ): Promise<string> {
-    const config = MESSAGE_TYPE_CONFIG[messageType] || MESSAGE_TYPE_CONFIG.notificacion;
-    const expirationHours = options?.expirationHours || config.expirationHours;
-    const expiresAt = new Date(Date.now() + expirationHours * 60 * 60 * 1000).toISOString();
-
-    const { data, error } = await this.supabase.client
-      .from('message_queue')
-      .insert({
-        team_member_id: teamMember.id,
-        team_member_phone: teamMember.phone,
-        team_member_name: teamMember.name,
-        message_type: messageType,
-        message_content: messageContent,
-        message_preview: messageContent.substring(0, 100),
-        status,
-        priority: options?.priority || config.priority,
-        expires_at: expiresAt,
-        template_sent_at: status === 'template_sent' ? new Date().toISOString() : null,
-        metadata: options?.metadata || {}
-      })
-      .select('id')
-      .single();
+  private isWindowOpen(teamMember: any): boolean {
+    const notes = safeJsonParse(teamMember?.notes);
+    const lastInteraction = notes.last_sara_interaction;
+    const hace24h = new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString();
+    return !!(lastInteraction && lastInteraction > hace24h);
+  }
 
-    if (error) {
-      console.error(`❌ [MQ] Error insertando en cola:`, error);
-      throw error;
-    }
+  private buildTemplateJob(teamMember: any, messageType: MessageType): SendManyJob {
+    const config = MESSAGE_TYPE_CONFIG[messageType] || MESSAGE_TYPE_CONFIG.notificacion;
+    const nombreCorto = teamMember.name?.split(' ')[0] || 'Hola';
+    return {
+      to: teamMember.phone,
+      template: {
+        name: config.templateName,
+        languageCode: 'es_MX',
+        components: [{ type: 'body', parameters: [{ type: 'text', text: nombreCorto }] }]
+      }
+    };
+  }
 
-    await this.logAudit(data.id, 'created', {
-      message_type: messageType,
+  /**
+   * Arma la fila de message_queue (el insert lo hace enqueueMany en lote)
+   */
+  private buildQueueRow(
+    teamMember: any,
+    item: EnqueueManyItem,
+    status: MessageStatus,
+    lastError?: string
+  ): Record<string, any> {
+    const config = MESSAGE_TYPE_CONFIG[item.messageType] || MESSAGE_TYPE_CONFIG.notificacion;
+    const expirationHours = item.options?.expirationHours || config.expirationHours;
+    const now = new Date();
+    return {
+      team_member_id: teamMember.id,
+      team_member_phone: teamMember.phone,
+      team_member_name: teamMember.name,
+      message_type: item.messageType,
+      message_content: item.messageContent,
+      message_preview: item.messageContent.substring(0, 100),
       status,
-      expires_at: expiresAt
-    });
-
-    return data.id;
+      priority: item.options?.priority || config.priority,
+      expires_at: new Date(now.getTime() + expirationHours * 60 * 60 * 1000).toISOString(),
+      template_sent_at: status === 'template_sent' ? now.toISOString() : null,
+      next_retry_at: status === 'queued' ? now.toISOString() : null,
+      last_error: lastError ? lastError.substring(0, 500) : null,
+      metadata: item.options?.metadata || {}
+    };
   }
 
   /**
@@ -432,6 +638,21 @@ export class MessageQueueService {
     }
   }
 
+  /**
+   * Registra varios eventos en auditoría con un insert multi-row
+   */
+  private async logAuditMany(rows: Array<{ message_id: string | null; event: string; details: Record<string, any> }>): Promise<void> {
+    if (rows.length === 0) return;
+    try {
+      await this.supabase.client
+        .from('message_audit_log')
+        .insert(rows);
+    } catch (error) {
+      console.error(`⚠️ [MQ] Error en auditoría:`, error);
+      // No fallar por error de auditoría
+    }
+  }
+
   // ═══════════════════════════════════════════════════════════════════════════
   // COMPATIBILIDAD CON SISTEMA LEGACY (notes)
   // ═══════════════════════════════════════════════════════════════════════════
@@ -439,22 +660,30 @@ export class MessageQueueService {
   /**
    * Guarda mensaje pendiente en notes (sistema legacy)
    */
-  private async savePendingToNotes(teamMember: any, messageType: MessageType, messageContent: string): Promise<void> {
+  private async savePendingToNotes(
+    teamMember: any,
+    pendings: Array<{ messageType: MessageType; messageContent: string }>
+  ): Promise<void> {
     const notes = safeJsonParse(teamMember.notes);
-
-    const pendingKey = this.getPendingKey(messageType);
-
-    notes[pendingKey] = {
-      sent_at: new Date().toISOString(),
-      mensaje_completo: messageContent
-    };
+    const sentAt = new Date().toISOString();
+
+    const keys: string[] = [];
+    for (const { messageType, messageContent } of pendings) {
+      const pendingKey = this.getPendingKey(messageType);
+      notes[pendingKey] = {
+        sent_at: sentAt,
+        mensaje_completo: messageContent
+      };
+      keys.push(pendingKey);
+    }
 
     await this.supabase.client
       .from('team_members')
       .update({ notes })
       .eq('id', teamMember.id);
+    getEntityCache(this.supabase).patchTeamMember(teamMember.id, { notes });
 
-    console.log(`   💾 [MQ] Guardado en notes.${pendingKey}`);
+    console.log(`   💾 [MQ] Guardado en notes.${keys.join(', notes.')}`);
   }
 
   /**
@@ -536,6 +765,7 @@ export class MessageQueueService {
       .from('team_members')
       .update({ notes })
       .eq('id', teamMemberId);
+    getEntityCache(this.supabase).patchTeamMember(teamMemberId, { notes });
   }
 
   /**
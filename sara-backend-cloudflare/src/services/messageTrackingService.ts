@@ -3,6 +3,7 @@
  */
 
 import { SupabaseService } from './supabase';
+import { advancesStatus } from './deliveryStatusService';
 
 export type MessageType = 'text' | 'audio' | 'image' | 'video' | 'document' | 'template' | 'buttons' | 'list';
 export type RecipientType = 'lead' | 'team_member';
@@ -16,6 +17,16 @@ export interface MessageData {
   messageType: MessageType;
   categoria?: string;  // 'respuesta_sara', 'recordatorio', 'alerta', 'broadcast', 'bridge', etc.
   contenido?: string;  // Preview del mensaje (primeros 200 chars)
+  sentAt?: string;     // Default: momento del insert (el buffer conserva la hora real de envío)
+}
+
+export type DeliveryStatus = 'delivered' | 'read' | 'failed';
+
+export interface StatusEvent {
+  messageId: string;
+  status: DeliveryStatus;
+  errorMessage?: string;
+  at?: string; // Hora del evento (default: ahora)
 }
 
 export interface MessageMetrics {
@@ -68,24 +79,50 @@ export class MessageTrackingService {
   }
 
   /**
-   * Actualiza el estado de un mensaje
+   * Registra varios mensajes enviados en un solo insert multi-row
    */
-  async updateMessageStatus(messageId: string, status: 'delivered' | 'read' | 'failed', errorMessage?: string): Promise<boolean> {
+  async logMessagesSent(items: MessageData[]): Promise<boolean> {
+    if (items.length === 0) return true;
     try {
-      const updateData: any = {
-        status,
-        updated_at: new Date().toISOString()
-      };
+      const sentAt = new Date().toISOString();
+      const { error } = await this.supabase.client
+        .from('messages_sent')
+        .insert(items.map(data => ({
+          message_id: data.messageId,
+          recipient_phone: data.recipientPhone,
+          recipient_type: data.recipientType,
+          recipient_id: data.recipientId,
+          recipient_name: data.recipientName,
+          message_type: data.messageType,
+          categoria: data.categoria || 'general',
+          contenido: data.contenido?.substring(0, 200),
+          status: 'sent',
+          sent_at: data.sentAt || sentAt
+        })));
 
-      if (status === 'delivered') {
-        updateData.delivered_at = new Date().toISOString();
-      } else if (status === 'read') {
-        updateData.read_at = new Date().toISOString();
-      } else if (status === 'failed') {
-        updateData.failed_at = new Date().toISOString();
-        updateData.error_message = errorMessage;
+      if (error) {
+        if (error.code === '42P01') {
+          console.log(`📊 Message Tracking: tabla no existe, solo log`);
+          return false;
+        }
+        console.error('Error logging messages sent (batch):', error);
+        return false;
       }
 
+      return true;
+    } catch (e) {
+      console.error('Error en logMessagesSent:', e);
+      return false;
+    }
+  }
+
+  /**
+   * Actualiza el estado de un mensaje
+   */
+  async updateMessageStatus(messageId: string, status: DeliveryStatus, errorMessage?: string): Promise<boolean> {
+    try {
+      const updateData = buildStatusUpdate(status, errorMessage, new Date().toISOString());
+
       const { error } = await this.supabase.client
         .from('messages_sent')
         .update(updateData)
@@ -104,6 +141,55 @@ export class MessageTrackingService {
     }
   }
 
+  /**
+   * Actualiza varios estados: un UPDATE ... WHERE message_id IN (...) por
+   * combinación status + error (normalmente 1-3 statements por lote).
+   * Antes de agrupar se queda con el estado de mayor rango por message_id
+   * (como DeliveryStatusBuffer): los grupos se aplican en cualquier orden y
+   * un delivered→read del mismo mensaje no debe terminar en delivered.
+   */
+  async updateMessageStatuses(events: StatusEvent[]): Promise<boolean> {
+    if (events.length === 0) return true;
+    const latest = new Map<string, StatusEvent>();
+    for (const ev of events) {
+      const current = latest.get(ev.messageId);
+      if (!current || advancesStatus(current.status, ev.status)) latest.set(ev.messageId, ev);
+    }
+
+    const groups = new Map<string, { status: DeliveryStatus; errorMessage?: string; at: string; ids: string[] }>();
+    const now = new Date().toISOString();
+    for (const ev of latest.values()) {
+      const key = `${ev.status}|${ev.errorMessage || ''}`;
+      const group = groups.get(key);
+      if (group) {
+        group.ids.push(ev.messageId);
+        if (ev.at && ev.at < group.at) group.at = ev.at;
+      } else {
+        groups.set(key, { status: ev.status, errorMessage: ev.errorMessage, at: ev.at || now, ids: [ev.messageId] });
+      }
+    }
+
+    let ok = true;
+    for (const group of groups.values()) {
+      try {
+        const { error } = await this.supabase.client
+          .from('messages_sent')
+          .update(buildStatusUpdate(group.status, group.errorMessage, group.at))
+          .in('message_id', group.ids);
+
+        if (error) {
+          if (error.code === '42P01') return false;
+          console.error('Error updating message statuses (batch):', error);
+          ok = false;
+        }
+      } catch (e) {
+        console.error('Error en updateMessageStatuses:', e);
+        ok = false;
+      }
+    }
+    return ok;
+  }
+
   /**
    * Obtiene métricas de mensajes de los últimos N días
    */
@@ -230,6 +316,149 @@ export class MessageTrackingService {
   }
 }
 
+function buildStatusUpdate(status: DeliveryStatus, errorMessage: string | undefined, at: string): Record<string, any> {
+  const updateData: any = {
+    status,
+    updated_at: at
+  };
+
+  if (status === 'delivered') {
+    updateData.delivered_at = at;
+  } else if (status === 'read') {
+    updateData.read_at = at;
+  } else if (status === 'failed') {
+    updateData.failed_at = at;
+    updateData.error_message = errorMessage;
+  }
+  return updateData;
+}
+
 export function createMessageTrackingService(supabase: SupabaseService): MessageTrackingService {
   return new MessageTrackingService(supabase);
 }
+
+// ═══════════════════════════════════════════════════════════════════════════
+// TRACKING BUFFER - Acumula envíos y estados durante un request / CRON
+// ═══════════════════════════════════════════════════════════════════════════
+// En vez de 1 insert por mensaje, junta los eventos en memoria y los escribe
+// como insert multi-row + updates agrupados. El flush corre en ctx.waitUntil
+// (no agrega latencia al envío) y se dispara al llegar a maxSize eventos o a
+// maxAgeMs desde el primer evento pendiente, lo que ocurra primero.
+// ═══════════════════════════════════════════════════════════════════════════
+
+export interface TrackingBufferOptions {
+  waitUntil?: (promise: Promise<any>) => void; // ctx.waitUntil del request/CRON
+  maxSize?: number;   // Eventos antes de forzar flush
+  maxAgeMs?: number;  // Tiempo máximo que un evento espera en memoria
+  onSentFlushed?: (count: number) => Promise<void>; // ej. métrica SaaS messages_sent
+}
+
+export const TRACKING_BUFFER_MAX_SIZE = 50;
+export const TRACKING_BUFFER_MAX_AGE_MS = 5000;
+
+export class MessageTrackingBuffer {
+  private sent: MessageData[] = [];
+  private statuses: StatusEvent[] = [];
+  private gate: (() => void) | null = null;
+  private timer: ReturnType<typeof setTimeout> | null = null;
+  private inFlight: Set<Promise<void>> = new Set();
+  private flushes = 0;
+  private rowsWritten = 0;
+  private maxSize: number;
+  private maxAgeMs: number;
+
+  constructor(private tracking: MessageTrackingService, private options: TrackingBufferOptions = {}) {
+    this.maxSize = options.maxSize || TRACKING_BUFFER_MAX_SIZE;
+    this.maxAgeMs = options.maxAgeMs || TRACKING_BUFFER_MAX_AGE_MS;
+  }
+
+  /** Registra un envío (síncrono, no espera I/O) */
+  addSent(data: MessageData): void {
+    this.sent.push({ ...data, sentAt: data.sentAt || new Date().toISOString() });
+    this.schedule();
+  }
+
+  /** Registra un cambio de estado (delivered/read/failed) */
+  addStatus(messageId: string, status: DeliveryStatus, errorMessage?: string): void {
+    this.statuses.push({ messageId, status, errorMessage, at: new Date().toISOString() });
+    this.schedule();
+  }
+
+  getPendingCount(): number {
+    return this.sent.length + this.statuses.length;
+  }
+
+  getStats(): { pending: number; flushes: number; rowsWritten: number } {
+    return { pending: this.getPendingCount(), flushes: this.flushes, rowsWritten: this.rowsWritten };
+  }
+
+  /**
+   * Escribe lo pendiente ya y espera a que terminen todos los flush en curso.
+   * Llamar al final del CRON (antes de cambiar de tenant) o en tests.
+   */
+  async flush(): Promise<void> {
+    while (this.gate || this.inFlight.size > 0) {
+      this.release();
+      await Promise.all(Array.from(this.inFlight));
+    }
+  }
+
+  private schedule(): void {
+    if (!this.gate) {
+      // Primer evento del lote: abrir compuerta con límite de tiempo y registrar
+      // el flush en waitUntil desde ya, para que el runtime no lo corte
+      const opened = new Promise<void>(resolve => { this.gate = resolve; });
+      this.timer = setTimeout(() => this.release(), this.maxAgeMs);
+      this.track(opened.then(() => this.flushNow()));
+    }
+    if (this.getPendingCount() >= this.maxSize) {
+      this.release();
+    }
+  }
+
+  private release(): void {
+    if (this.timer) {
+      clearTimeout(this.timer);
+      this.timer = null;
+    }
+    const gate = this.gate;
+    this.gate = null;
+    if (gate) gate();
+  }
+
+  private track(promise: Promise<void>): void {
+    const tracked = promise.catch(e => console.error('📊 Tracking buffer flush error:', e));
+    this.inFlight.add(tracked);
+    tracked.finally(() => this.inFlight.delete(tracked));
+    if (this.options.waitUntil) {
+      try { this.options.waitUntil(tracked); } catch { /* ctx ya cerrado */ }
+    }
+  }
+
+  private async flushNow(): Promise<void> {
+    const sent = this.sent;
+    const statuses = this.statuses;
+    this.sent = [];
+    this.statuses = [];
+    if (sent.length === 0 && statuses.length === 0) return;
+
+    this.flushes++;
+    // Primero los envíos: un status del mismo lote necesita que la fila exista
+    if (sent.length > 0) {
+      const ok = await this.tracking.logMessagesSent(sent);
+      if (ok) this.rowsWritten += sent.length;
+      if (this.options.onSentFlushed) {
+        await this.options.onSentFlushed(sent.length).catch(() => {});
+      }
+    }
+    if (statuses.length > 0) {
+      const ok = await this.tracking.updateMessageStatuses(statuses);
+      if (ok) this.rowsWritten += statuses.length;
+    }
+    console.log(`📊 Tracking buffer: ${sent.length} envíos + ${statuses.length} estados en 1 flush`);
+  }
+}
+
+export function createMessageTrackingBuffer(supabase: SupabaseService, options: TrackingBufferOptions = {}): MessageTrackingBuffer {
+  return new MessageTrackingBuffer(createMessageTrackingService(supabase), options);
+}
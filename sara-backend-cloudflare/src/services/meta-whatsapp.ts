@@ -128,6 +128,46 @@ export type WindowClosedCallback = (data: {
   meta: MetaWhatsAppService;
 }) => Promise<{ sent: boolean; method: string; messageId?: string }>;
 
+// Callbacks en lote: sendMany() acumula tracking/fallidos y los entrega juntos
+// (un insert multi-row en vez de N inserts)
+export type BatchTrackingCallback = (items: Parameters<MessageTrackingCallback>[0][]) => Promise<void>;
+export type BatchFailedMessageCallback = (items: Parameters<FailedMessageCallback>[0][]) => Promise<void>;
+
+// Job para sendMany: texto libre o template
+export interface SendManyJob {
+  to: string;
+  text?: string;
+  template?: { name: string; languageCode?: string; components?: any[] };
+  image?: { url: string; caption?: string };
+  bypassRateLimit?: boolean; // Override por job (default: el de options o el del método)
+}
+
+export interface SendManyOptions {
+  concurrency?: number;      // Destinatarios en paralelo (default SEND_MANY_DEFAULT_CONCURRENCY)
+  bypassRateLimit?: boolean; // Default para todos los jobs
+  requeue?: boolean;         // false = no mandar fallidos/rate-limited a retry queue (el caller maneja el reintento)
+}
+
+export interface SendManyResult {
+  index: number;   // Posición del job en el arreglo original
+  to: string;
+  ok: boolean;     // true si no lanzó (rate_limited/enqueued también cuenta como ok)
+  result?: any;
+  error?: string;
+}
+
+// Contexto de un sendMany(): viaja explícito hasta track/notifyFailed de los
+// envíos del lote, así un envío ajeno concurrente en la misma instancia no
+// termina acumulado en el lote
+interface SendBatch {
+  tracking: Parameters<MessageTrackingCallback>[0][];
+  failed: Parameters<FailedMessageCallback>[0][];
+  requeue: boolean; // false = fallidos/rate-limited de este lote no van a la retry queue
+}
+
+// Meta permite ~80 msgs/min; con 4 destinatarios en paralelo el límite global (KV) sigue mandando
+export const SEND_MANY_DEFAULT_CONCURRENCY = 4;
+
 export class MetaWhatsAppService {
   private phoneNumberId: string;
   private accessToken: string;
@@ -136,6 +176,10 @@ export class MetaWhatsAppService {
   private failedMessageCallback?: FailedMessageCallback;
   private rateLimitEnqueueCallback?: RateLimitEnqueueCallback;
   private windowClosedCallback?: WindowClosedCallback;
+  private batchTrackingCallback?: BatchTrackingCallback;
+  private batchFailedMessageCallback?: BatchFailedMessageCallback;
+  // Serializa el read-modify-write del contador KV cuando hay envíos concurrentes
+  private rateLimitChain: Promise<unknown> = Promise.resolve();
   private preSendCheck?: () => Promise<{ allowed: boolean; current: number; limit: number; warning: boolean; percentage: number }>;
   private kvNamespace?: KVNamespace;
   private adminPhone: string = DEFAULT_ADMIN_PHONE;
@@ -171,8 +215,17 @@ export class MetaWhatsAppService {
    * Verifica y actualiza el rate limit global usando KV.
    * Retorna true si se puede enviar, false si se debe encolar.
    */
-  private async checkGlobalRateLimit(): Promise<boolean> {
-    if (!this.kvNamespace) return true; // Sin KV, no limitar
+  private checkGlobalRateLimit(): Promise<boolean> {
+    if (!this.kvNamespace) return Promise.resolve(true); // Sin KV, no limitar
+    // get + put no es atómico: encadenar para que envíos concurrentes (sendMany)
+    // de este isolate no lean el mismo contador y se pasen del límite
+    const check = this.rateLimitChain.then(() => this._checkGlobalRateLimitKV());
+    this.rateLimitChain = check.catch(() => {});
+    return check;
+  }
+
+  private async _checkGlobalRateLimitKV(): Promise<boolean> {
+    if (!this.kvNamespace) return true;
 
     try {
       const minuteKey = `meta_rate:${Math.floor(Date.now() / 60000)}`;
@@ -206,6 +259,22 @@ export class MetaWhatsAppService {
     this.failedMessageCallback = callback;
   }
 
+  /**
+   * Callback opcional para entregar el tracking de un sendMany() en un solo llamado.
+   * Sin él, al terminar el lote se invoca setTrackingCallback por cada mensaje.
+   */
+  setBatchTrackingCallback(callback: BatchTrackingCallback): void {
+    this.batchTrackingCallback = callback;
+  }
+
+  /**
+   * Callback opcional para entregar los fallidos de un sendMany() en un solo llamado.
+   * Sin él, al terminar el lote se invoca setFailedMessageCallback por cada fallido.
+   */
+  setBatchFailedMessageCallback(callback: BatchFailedMessageCallback): void {
+    this.batchFailedMessageCallback = callback;
+  }
+
   setWindowClosedCallback(callback: WindowClosedCallback): void {
     this.windowClosedCallback = callback;
   }
@@ -231,12 +300,19 @@ export class MetaWhatsAppService {
     this.trackingCallback = undefined;
     this.failedMessageCallback = undefined;
     this.rateLimitEnqueueCallback = undefined;
+    this.batchTrackingCallback = undefined;
+    this.batchFailedMessageCallback = undefined;
   }
 
   /**
-   * Llama al callback de tracking si está configurado
+   * Llama al callback de tracking si está configurado.
+   * Dentro de sendMany() (batch) se acumula y se entrega al final del lote.
    */
-  private async track(data: Parameters<MessageTrackingCallback>[0]): Promise<void> {
+  private async track(data: Parameters<MessageTrackingCallback>[0], batch?: SendBatch): Promise<void> {
+    if (batch && (this.trackingCallback || this.batchTrackingCallback)) {
+      batch.tracking.push(data);
+      return;
+    }
     if (this.trackingCallback) {
       try {
         await this.trackingCallback(data);
@@ -247,6 +323,59 @@ export class MetaWhatsAppService {
     }
   }
 
+  /**
+   * Reporta un envío fallido (reintentos agotados) al callback de retry queue.
+   * Dentro de sendMany() se acumula y se entrega al final del lote.
+   */
+  private async notifyFailed(data: Parameters<FailedMessageCallback>[0], batch?: SendBatch): Promise<void> {
+    if (batch && !batch.requeue) return;
+    if (batch && (this.failedMessageCallback || this.batchFailedMessageCallback)) {
+      batch.failed.push(data);
+      return;
+    }
+    if (this.failedMessageCallback) {
+      try {
+        await this.failedMessageCallback(data);
+      } catch (cbErr) { console.error('failedMessageCallback error:', cbErr); }
+    }
+  }
+
+  /** Encola un envío frenado por el rate limit global (salvo sendMany con requeue: false) */
+  private async notifyRateLimited(data: Parameters<RateLimitEnqueueCallback>[0], batch?: SendBatch): Promise<void> {
+    if ((batch && !batch.requeue) || !this.rateLimitEnqueueCallback) return;
+    await this.rateLimitEnqueueCallback(data);
+  }
+
+  /**
+   * Entrega tracking y fallidos acumulados durante un lote.
+   * Usa los callbacks batch si existen; si no, cae a los callbacks por mensaje.
+   */
+  private async flushBatchCallbacks(batch: SendBatch): Promise<void> {
+    const { tracking, failed } = batch;
+
+    if (tracking.length > 0) {
+      try {
+        if (this.batchTrackingCallback) {
+          await this.batchTrackingCallback(tracking);
+        } else if (this.trackingCallback) {
+          for (const item of tracking) await this.trackingCallback(item);
+        }
+      } catch (e) {
+        console.log(`📊 Tracking error (batch): ${(e as Error).message}`);
+      }
+    }
+
+    if (failed.length > 0) {
+      try {
+        if (this.batchFailedMessageCallback) {
+          await this.batchFailedMessageCallback(failed);
+        } else if (this.failedMessageCallback) {
+          for (const item of failed) await this.failedMessageCallback(item);
+        }
+      } catch (cbErr) { console.error('failedMessageCallback error (batch):', cbErr); }
+    }
+  }
+
   private normalizePhone(phone: string): string {
     let clean = phone.replace('whatsapp:', '').replace(/\s/g, '');
     if (clean.startsWith('+')) {
@@ -318,20 +447,17 @@ export class MetaWhatsAppService {
     url: string,
     options: RequestInit,
     context: string,
-    callbackInfo: { recipientPhone: string; messageType: string; payload: any }
+    callbackInfo: { recipientPhone: string; messageType: string; payload: any },
+    batch?: SendBatch
   ): Promise<Response> {
     try {
       return await this.fetchWithRetry(url, options, context);
     } catch (retryError: any) {
-      if (this.failedMessageCallback) {
-        try {
-          await this.failedMessageCallback({
-            ...callbackInfo,
-            context,
-            errorMessage: retryError?.message || String(retryError)
-          });
-        } catch (cbErr) { console.error('failedMessageCallback error:', cbErr); }
-      }
+      await this.notifyFailed({
+        ...callbackInfo,
+        context,
+        errorMessage: retryError?.message || String(retryError)
+      }, batch);
       throw retryError;
     }
   }
@@ -363,6 +489,10 @@ export class MetaWhatsAppService {
   // Solo broadcasts/mensajes automatizados deben usar bypassRateLimit = false
   // ═══════════════════════════════════════════════════════════════════════════
   async sendWhatsAppMessage(to: string, body: string, bypassRateLimit = true): Promise<any> {
+    return this.deliverText(to, body, bypassRateLimit);
+  }
+
+  private async deliverText(to: string, body: string, bypassRateLimit: boolean, batch?: SendBatch): Promise<any> {
     const phone = this.normalizePhone(to);
     const now = Date.now();
 
@@ -461,27 +591,25 @@ export class MetaWhatsAppService {
       }
       let lastResult: any;
       for (const chunk of chunks) {
-        lastResult = await this._sendSingleMessage(phone, chunk, bypassRateLimit);
+        lastResult = await this._sendSingleMessage(phone, chunk, bypassRateLimit, batch);
       }
       return lastResult;
     }
 
-    return this._sendSingleMessage(phone, cleanBody, bypassRateLimit);
+    return this._sendSingleMessage(phone, cleanBody, bypassRateLimit, batch);
   }
 
-  private async _sendSingleMessage(phone: string, body: string, bypassRateLimit: boolean): Promise<any> {
+  private async _sendSingleMessage(phone: string, body: string, bypassRateLimit: boolean, batch?: SendBatch): Promise<any> {
     // 🚦 Global Meta API rate limit check (KV-based)
     const canSend = await this.checkGlobalRateLimit();
     if (!canSend) {
       console.warn(`🚦 Rate limited: enqueuing text message to ${phone}`);
-      if (this.rateLimitEnqueueCallback) {
-        await this.rateLimitEnqueueCallback({
-          recipientPhone: phone,
-          messageType: 'text',
-          payload: { body },
-          context: `rateLimited:text:${phone}`
-        });
-      }
+      await this.notifyRateLimited({
+        recipientPhone: phone,
+        messageType: 'text',
+        payload: { body },
+        context: `rateLimited:text:${phone}`
+      }, batch);
       return { rate_limited: true, enqueued: true, phone };
     }
 
@@ -509,17 +637,13 @@ export class MetaWhatsAppService {
       }, `sendMessage:${phone}`);
     } catch (retryError: any) {
       // All retries exhausted — enqueue for later retry
-      if (this.failedMessageCallback) {
-        try {
-          await this.failedMessageCallback({
-            recipientPhone: phone,
-            messageType: 'text',
-            payload: { body },
-            context: `sendMessage:${phone}`,
-            errorMessage: retryError?.message || String(retryError)
-          });
-        } catch (cbErr) { console.error('failedMessageCallback error:', cbErr); }
-      }
+      await this.notifyFailed({
+        recipientPhone: phone,
+        messageType: 'text',
+        payload: { body },
+        context: `sendMessage:${phone}`,
+        errorMessage: retryError?.message || String(retryError)
+      }, batch);
       throw retryError;
     }
 
@@ -557,12 +681,78 @@ export class MetaWhatsAppService {
         messageType: 'text',
         categoria: bypassRateLimit ? 'respuesta_sara' : 'broadcast',
         contenido: body.substring(0, 200)
-      });
+      }, batch);
     }
 
     return data;
   }
 
+  // ═══════════════════════════════════════════════════════════════════════════
+  // 📦 ENVÍO EN LOTE (sendMany)
+  // ═══════════════════════════════════════════════════════════════════════════
+  // - Agrupa jobs por destinatario: los de un mismo teléfono van en orden
+  //   (y cada mensaje largo conserva el orden de sus chunks)
+  // - Hasta `concurrency` destinatarios en paralelo, todos pasando por
+  //   checkGlobalRateLimit (75/min en KV) y el circuit breaker
+  // - Tracking y fallidos se entregan en lote al terminar
+  // - Nunca lanza: cada job devuelve su propio resultado
+  // ═══════════════════════════════════════════════════════════════════════════
+  async sendMany(jobs: SendManyJob[], options: SendManyOptions = {}): Promise<SendManyResult[]> {
+    const results: SendManyResult[] = new Array(jobs.length);
+    if (jobs.length === 0) return results;
+
+    // Un carril por destinatario; el orden dentro del carril = orden de entrada
+    const lanes = new Map<string, number[]>();
+    jobs.forEach((job, index) => {
+      const key = this.normalizePhone(job.to || '');
+      const lane = lanes.get(key);
+      if (lane) lane.push(index);
+      else lanes.set(key, [index]);
+    });
+    const laneList = Array.from(lanes.values());
+    const concurrency = Math.max(1, Math.min(options.concurrency || SEND_MANY_DEFAULT_CONCURRENCY, laneList.length));
+
+    const batch: SendBatch = { tracking: [], failed: [], requeue: options.requeue !== false };
+    let nextLane = 0;
+    const worker = async () => {
+      while (nextLane < laneList.length) {
+        const lane = laneList[nextLane++];
+        for (const index of lane) {
+          const job = jobs[index];
+          try {
+            const result = await this.sendJob(job, job.bypassRateLimit ?? options.bypassRateLimit, batch);
+            results[index] = { index, to: job.to, ok: true, result };
+          } catch (e) {
+            results[index] = { index, to: job.to, ok: false, error: (e as Error)?.message || String(e) };
+          }
+        }
+      }
+    };
+
+    try {
+      await Promise.all(Array.from({ length: concurrency }, () => worker()));
+    } finally {
+      await this.flushBatchCallbacks(batch);
+    }
+
+    const okCount = results.filter(r => r.ok).length;
+    console.log(`📦 sendMany: ${okCount}/${jobs.length} OK (${laneList.length} destinatarios, concurrencia ${concurrency})`);
+    return results;
+  }
+
+  private async sendJob(job: SendManyJob, bypassRateLimit: boolean | undefined, batch: SendBatch): Promise<any> {
+    if (job.template) {
+      return this.deliverTemplate(job.to, job.template.name, job.template.languageCode || 'es', job.template.components, bypassRateLimit ?? false, batch);
+    }
+    if (job.image) {
+      return this.deliverImage(job.to, job.image.url, job.image.caption, batch);
+    }
+    if (typeof job.text === 'string') {
+      return this.deliverText(job.to, job.text, bypassRateLimit ?? true, batch);
+    }
+    throw new Error('sendMany: job sin text, template ni image');
+  }
+
   // Enviar alerta crítica al admin (intenta template primero, fallback texto directo)
   private async sendAlertToAdmin(message: string): Promise<void> {
     try {
@@ -629,6 +819,10 @@ export class MetaWhatsAppService {
   }
 
   async sendWhatsAppImage(to: string, imageUrl: string, caption?: string): Promise<any> {
+    return this.deliverImage(to, imageUrl, caption);
+  }
+
+  private async deliverImage(to: string, imageUrl: string, caption: string | undefined, batch?: SendBatch): Promise<any> {
     const phone = this.normalizePhone(to);
     const url = `https://graph.facebook.com/${this.apiVersion}/${this.phoneNumberId}/messages`;
 
@@ -650,7 +844,7 @@ export class MetaWhatsAppService {
       body: JSON.stringify(payload)
     }, `sendImage:${phone}`, {
       recipientPhone: phone, messageType: 'image', payload: { url: imageUrl, caption }
-    });
+    }, batch);
     const data = await response.json() as any;
 
     // 131047 = ventana cerrada → template fallback
@@ -669,7 +863,7 @@ export class MetaWhatsAppService {
         messageType: 'image',
         categoria: 'imagen',
         contenido: caption?.substring(0, 200) || 'Imagen enviada'
-      });
+      }, batch);
     }
 
     return data;
@@ -1354,6 +1548,17 @@ export class MetaWhatsAppService {
   // Por default aplican rate limiting (bypassRateLimit = false)
   // ═══════════════════════════════════════════════════════════════════════════
   async sendTemplate(to: string, templateName: string, languageCode: string = 'es', components?: any[], bypassRateLimit: boolean = false): Promise<any> {
+    return this.deliverTemplate(to, templateName, languageCode, components, bypassRateLimit);
+  }
+
+  private async deliverTemplate(
+    to: string,
+    templateName: string,
+    languageCode: string,
+    components: any[] | undefined,
+    bypassRateLimit: boolean,
+    batch?: SendBatch
+  ): Promise<any> {
     const phone = this.normalizePhone(to);
     const now = Date.now();
 
@@ -1367,14 +1572,12 @@ export class MetaWhatsAppService {
     const canSend = await this.checkGlobalRateLimit();
     if (!canSend) {
       console.warn(`🚦 Rate limited: enqueuing template "${templateName}" to ${phone}`);
-      if (this.rateLimitEnqueueCallback) {
-        await this.rateLimitEnqueueCallback({
-          recipientPhone: phone,
-          messageType: 'template',
-          payload: { templateName, languageCode, components },
-          context: `rateLimited:template:${phone}`
-        });
-      }
+      await this.notifyRateLimited({
+        recipientPhone: phone,
+        messageType: 'template',
+        payload: { templateName, languageCode, components },
+        context: `rateLimited:template:${phone}`
+      }, batch);
       return { rate_limited: true, enqueued: true, phone, template: templateName };
     }
 
@@ -1451,17 +1654,13 @@ export class MetaWhatsAppService {
         body: JSON.stringify(payload)
       }, `sendTemplate:${templateName}:${phone}`);
     } catch (retryError: any) {
-      if (this.failedMessageCallback) {
-        try {
-          await this.failedMessageCallback({
-            recipientPhone: phone,
-            messageType: 'template',
-            payload: { templateName, languageCode, components },
-            context: `sendTemplate:${templateName}:${phone}`,
-            errorMessage: retryError?.message || String(retryError)
-          });
-        } catch (cbErr) { console.error('failedMessageCallback error:', cbErr); }
-      }
+      await this.notifyFailed({
+        recipientPhone: phone,
+        messageType: 'template',
+        payload: { templateName, languageCode, components },
+        context: `sendTemplate:${templateName}:${phone}`,
+        errorMessage: retryError?.message || String(retryError)
+      }, batch);
       throw retryError;
     }
 
@@ -1481,7 +1680,7 @@ export class MetaWhatsAppService {
         messageType: 'template',
         categoria: `template_${templateName}`,
         contenido: `Template: ${templateName}`
-      });
+      }, batch);
     }
 
     return data;
@@ -1591,17 +1790,13 @@ export class MetaWhatsAppService {
         body: JSON.stringify(payload)
       }, `sendCarousel:${templateName}:${phone}`);
     } catch (retryError: any) {
-      if (this.failedMessageCallback) {
-        try {
-          await this.failedMessageCallback({
-            recipientPhone: phone,
-            messageType: 'template',
-            payload: { templateName, languageCode, components },
-            context: `sendCarousel:${templateName}:${phone}`,
-            errorMessage: retryError?.message || String(retryError)
-          });
-        } catch (cbErr) { console.error('failedMessageCallback error:', cbErr); }
-      }
+      await this.notifyFailed({
+        recipientPhone: phone,
+        messageType: 'template',
+        payload: { templateName, languageCode, components },
+        context: `sendCarousel:${templateName}:${phone}`,
+        errorMessage: retryError?.message || String(retryError)
+      });
       throw retryError;
     }
 
@@ -9,6 +9,7 @@ import { SupabaseService } from './supabase';
 import { sendEmail } from './emailService';
 import { Env } from '../types/env';
 import { logErrorToDB } from '../crons/healthCheck';
+import { createDailyMetrics, summarizeDailyMetrics, avgResponseMinutes, toDayKey } from './dailyMetricsService';
 
 // ─── Colors & Branding ──────────────────────────────────────────────────
 
@@ -224,6 +225,11 @@ export class MonthlyEmailReportService {
     const monthLabel = `${MESES[reportMonth]} ${reportYear}`;
     const monthKey = `${reportYear}-${String(reportMonth + 1).padStart(2, '0')}`;
 
+    // ═══ ROLLUP (mes anterior + tendencia 3 meses) ═══
+    // Los comparativos salen de daily_metrics; si no está disponible, queries crudas
+    const rollup = await createDailyMetrics(this.supabase).getRange(toDayKey(trend3Start), toDayKey(endReport));
+    const skip = Promise.resolve({ data: null as any[] | null });
+
     // ═══ PARALLEL QUERIES ═══
     const [
       { data: leadsMonth },
@@ -242,7 +248,7 @@ export class MonthlyEmailReportService {
         .select('*, team_members:assigned_to(name)')
         .gte('created_at', startReport.toISOString())
         .lte('created_at', endReport.toISOString()),
-      this.supabase.client.from('leads')
+      rollup ? skip : this.supabase.client.from('leads')
         .select('id, first_response_at, created_at')
         .gte('created_at', startPrev.toISOString())
         .lte('created_at', endPrev.toISOString()),
@@ -251,7 +257,7 @@ export class MonthlyEmailReportService {
         .in('status', ['closed', 'delivered', 'sold'])
         .gte('status_changed_at', startReport.toISOString())
         .lte('status_changed_at', endReport.toISOString()),
-      this.supabase.client.from('leads')
+      rollup ? skip : this.supabase.client.from('leads')
         .select('id, properties(price)')
         .in('status', ['closed', 'delivered', 'sold'])
         .gte('status_changed_at', startPrev.toISOString())
@@ -273,12 +279,12 @@ export class MonthlyEmailReportService {
         .eq('role', 'vendedor')
         .eq('active', true),
       // 3-month leads for trends
-      this.supabase.client.from('leads')
+      rollup ? skip : this.supabase.client.from('leads')
         .select('id, created_at, first_response_at, status')
         .gte('created_at', trend3Start.toISOString())
         .lte('created_at', endReport.toISOString()),
       // 3-month sales for trends
-      this.supabase.client.from('leads')
+      rollup ? skip : this.supabase.client.from('leads')
         .select('id, status_changed_at, properties(price)')
         .in('status', ['closed', 'delivered', 'sold'])
         .gte('status_changed_at', trend3Start.toISOString())
@@ -294,14 +300,15 @@ export class MonthlyEmailReportService {
     // ═══ CALCULATIONS ═══
 
     const totalLeads = leadsMonth?.length || 0;
-    const totalLeadsPrev = leadsPrev?.length || 0;
     const totalSales = salesMonth?.length || 0;
-    const totalSalesPrev = salesPrev?.length || 0;
+    const prevRollup = rollup ? summarizeDailyMetrics(rollup, toDayKey(startPrev), toDayKey(endPrev)).totals : null;
+    const totalLeadsPrev = prevRollup ? prevRollup.leads : leadsPrev?.length || 0;
+    const totalSalesPrev = prevRollup ? prevRollup.sales : salesPrev?.length || 0;
 
     let totalRevenue = 0;
     for (const s of salesMonth || []) totalRevenue += (s as any).properties?.price || 2_000_000;
 
-    let totalRevenuePrev = 0;
+    let totalRevenuePrev = prevRollup ? prevRollup.revenue : 0;
     for (const s of salesPrev || []) totalRevenuePrev += (s as any).properties?.price || 2_000_000;
 
     const avgDealSize = totalSales > 0 ? totalRevenue / totalSales : 0;
@@ -364,9 +371,11 @@ export class MonthlyEmailReportService {
         if (diff > 0 && diff < 1440) responseTimesPrev.push(diff);
       }
     }
-    const avgResponseMinPrev = responseTimesPrev.length > 0
-      ? responseTimesPrev.reduce((a, b) => a + b, 0) / responseTimesPrev.length
-      : 0;
+    const avgResponseMinPrev = prevRollup
+      ? avgResponseMinutes(prevRollup)
+      : responseTimesPrev.length > 0
+        ? responseTimesPrev.reduce((a, b) => a + b, 0) / responseTimesPrev.length
+        : 0;
 
     // Team performance
     const teamPerformance = (vendedores || []).map((v: any) => {
@@ -475,6 +484,19 @@ export class MonthlyEmailReportService {
       const tEnd = new Date(tYear, tMonth + 1, 0, 23, 59, 59);
       const tLabel = `${MESES[tMonth].substring(0, 3)} ${tYear}`;
 
+      if (rollup) {
+        const t = summarizeDailyMetrics(rollup, toDayKey(tStart), toDayKey(tEnd)).totals;
+        trends.push({
+          month: tLabel,
+          leads: t.leads,
+          sales: t.sales,
+          revenue: t.revenue,
+          conversionRate: t.leads > 0 ? (t.sales / t.leads) * 100 : 0,
+          avgResponseMin: avgResponseMinutes(t),
+        });
+        continue;
+      }
+
       const tLeads = (allLeads3Mo || []).filter((l: any) => {
         const d = new Date(l.created_at);
         return d >= tStart && d <= tEnd;
@@ -3,6 +3,7 @@
 // ═══════════════════════════════════════════════════════════════════════════
 
 import { SupabaseService } from './supabase';
+import { SubrequestGovernor, CronTaskBudgetOptions, GovernorSummary } from './subrequestGovernor';
 
 // ═══════════════════════════════════════════════════════════════════════════
 // TYPES
@@ -15,6 +16,8 @@ export interface CronExecution {
   success: boolean;
   error?: string;
   itemsProcessed?: number;
+  subrequests?: number;
+  deferred?: boolean;
 }
 
 export interface CronRunSummary {
@@ -24,6 +27,8 @@ export interface CronRunSummary {
   tasks: CronExecution[];
   successCount: number;
   failCount: number;
+  deferredCount: number;
+  subrequests?: GovernorSummary;
 }
 
 export interface ObservabilityDashboard {
@@ -62,25 +67,43 @@ export class CronTracker {
   private executions: CronExecution[] = [];
   private trigger: string;
   private startTime: number;
+  private governor?: SubrequestGovernor;
 
-  constructor(trigger: string) {
+  constructor(trigger: string, governor?: SubrequestGovernor) {
     this.trigger = trigger;
     this.startTime = Date.now();
+    this.governor = governor;
   }
 
   /**
    * Wrap a CRON task with timing and error tracking.
    * Replaces bare safeCron with observability.
+   * With a SubrequestGovernor, low-priority tasks are deferred when the
+   * invocation budget runs low, and per-task subrequests are recorded.
    */
-  async track(name: string, fn: () => Promise<any>): Promise<void> {
+  async track(name: string, fn: () => Promise<any>, options: CronTaskBudgetOptions = {}): Promise<void> {
     const start = Date.now();
+    if (this.governor && !this.governor.shouldRun(name, options)) {
+      this.executions.push({
+        name,
+        startedAt: start,
+        duration_ms: 0,
+        success: true,
+        deferred: true,
+        subrequests: 0
+      });
+      return;
+    }
+
+    const task = this.governor?.beginTask(name, options);
     try {
       await fn();
       this.executions.push({
         name,
         startedAt: start,
         duration_ms: Date.now() - start,
-        success: true
+        success: true,
+        ...(task && { subrequests: task.used })
       });
     } catch (e) {
       const error = e instanceof Error ? e.message : String(e);
@@ -89,9 +112,12 @@ export class CronTracker {
         startedAt: start,
         duration_ms: Date.now() - start,
         success: false,
-        error
+        error,
+        ...(task && { subrequests: task.used })
       });
       console.error(`❌ Error en ${name}:`, e);
+    } finally {
+      this.governor?.endTask();
     }
   }
 
@@ -102,8 +128,10 @@ export class CronTracker {
       startedAt: new Date(this.startTime).toISOString(),
       totalDuration_ms: Date.now() - this.startTime,
       tasks: this.executions,
-      successCount: this.executions.filter(e => e.success).length,
-      failCount: this.executions.filter(e => !e.success).length
+      successCount: this.executions.filter(e => e.success && !e.deferred).length,
+      failCount: this.executions.filter(e => !e.success).length,
+      deferredCount: this.executions.filter(e => e.deferred).length,
+      ...(this.governor && { subrequests: this.governor.getSummary() })
     };
   }
 
@@ -113,19 +141,31 @@ export class CronTracker {
     try {
       await supabase.client.from('sara_logs').insert({
         tipo: 'cron_execution',
-        mensaje: `CRON ${summary.trigger}: ${summary.successCount}/${summary.tasks.length} OK en ${summary.totalDuration_ms}ms`,
+        mensaje: `CRON ${summary.trigger}: ${summary.successCount}/${summary.tasks.length - summary.deferredCount} OK en ${summary.totalDuration_ms}ms${summary.deferredCount > 0 ? ` (${summary.deferredCount} diferidas)` : ''}`,
         datos: {
           trigger: summary.trigger,
           totalDuration_ms: summary.totalDuration_ms,
           taskCount: summary.tasks.length,
           successCount: summary.successCount,
           failCount: summary.failCount,
+          deferredCount: summary.deferredCount,
           tasks: summary.tasks.map(t => ({
             name: t.name,
             duration_ms: t.duration_ms,
             success: t.success,
+            ...(t.subrequests !== undefined && { subrequests: t.subrequests }),
+            ...(t.deferred && { deferred: true }),
             ...(t.error && { error: t.error.slice(0, 200) })
           })),
+          // Subrequest consumption for capacity planning (limit 1000/invocation)
+          ...(summary.subrequests && {
+            subrequests: {
+              used: summary.subrequests.used,
+              limit: summary.subrequests.limit,
+              byKind: summary.subrequests.byKind,
+              deferred: summary.subrequests.deferred
+            }
+          }),
           // Flag slow tasks (>5s)
           slowTasks: summary.tasks
             .filter(t => t.duration_ms > 5000)
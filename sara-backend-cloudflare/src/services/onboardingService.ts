@@ -1,4 +1,5 @@
 import { SupabaseService } from './supabase';
+import { invalidateTenant } from '../middleware/tenant';
 
 // ═══════════════════════════════════════════════════════════════════════════
 // ONBOARDING SERVICE - Tenant onboarding wizard (4 steps)
@@ -106,6 +107,7 @@ export async function completeWhatsAppSetup(
   }).eq('id', tenantId);
 
   if (error) return { success: false, next_step: 1, error: error.message };
+  invalidateTenant(tenantId); // phone_number_id nuevo: el webhook debe resolverlo ya
   return completeStep(supabase, tenantId, 1, { phone_number_id: config.phone_number_id });
 }
 
@@ -138,6 +140,7 @@ export async function completeConfiguration(
   if (Object.keys(updates).length > 0) {
     const { error } = await supabase.client.from('tenants').update(updates).eq('id', tenantId);
     if (error) return { success: false, next_step: 4, error: error.message };
+    invalidateTenant(tenantId);
   }
   return completeStep(supabase, tenantId, 4, config as Record<string, any>);
 }
@@ -111,6 +111,238 @@ export interface ReportData {
   recommendations?: string[];
 }
 
+// ═══════════════════════════════════════════════════════════════════════════
+// SECTION AGGREGATES
+// Cada sección declara los agregados que necesita (SECTION_QUERIES). Se
+// calculan en SQL (migración 014) y se comparten entre secciones; sin la
+// migración, el worker los acumula página por página con columnas mínimas
+// sin retener las filas.
+// ═══════════════════════════════════════════════════════════════════════════
+
+export interface LeadStats {
+  total: number;
+  assigned: number;
+  sales: number; // sold + reserved
+  by_funnel: Record<string, number>;
+  closed: { count: number; revenue: number; avg_days: number }; // sold + reserved + delivered
+  sources: Array<{ source: string; count: number; sold: number }>;
+  developments: Array<{ development: string; count: number; sales: number; closed: number; revenue: number }>;
+  vendors: Array<{ assigned_to: string; leads: number; sales: number; closed: number; revenue: number }>;
+  hot: Array<{ name: string; score: number; interest: string }>;
+}
+
+export interface PipelineStats {
+  total_value: number;
+  stages: Array<{ stage: string; count: number; value: number }>;
+  expected_close_30d: number;
+  at_risk: Array<{ name: string; days_stuck: number }>;
+}
+
+export interface AppointmentStats {
+  scheduled: number;
+  completed: number;
+  no_show: number;
+  developments: Array<{ development: string; scheduled: number; completed: number }>;
+  vendors: Array<{ vendedor_id: string; completed: number }>;
+}
+
+export interface ReportQueries {
+  lead_stats: LeadStats;
+  pipeline: PipelineStats;
+  appointment_stats: AppointmentStats;
+  prev_sales: number;
+  team: Array<{ id: string; name: string }>;
+  goals: { company_goal: number | null; vendor_goals: Array<{ vendor_id: string; goal: number }> };
+}
+
+export type ReportQueryName = keyof ReportQueries;
+
+export const SECTION_QUERIES: Record<ReportSection, ReportQueryName[]> = {
+  executive_summary: ['lead_stats', 'appointment_stats', 'prev_sales'],
+  leads_overview: ['lead_stats'],
+  sales_metrics: ['lead_stats', 'team'],
+  pipeline_status: ['pipeline'],
+  team_performance: ['lead_stats', 'appointment_stats', 'team'],
+  appointments: ['appointment_stats'],
+  sources_analysis: [],
+  goals_progress: ['lead_stats', 'team', 'goals'],
+  recommendations: []
+};
+
+// Orden del documento HTML; recommendations siempre al final
+const HTML_SECTION_ORDER: ReportSection[] = ['executive_summary', 'sales_metrics', 'goals_progress', 'pipeline_status'];
+
+// Secciones que lee generateRecommendations
+const RECOMMENDATION_INPUTS: ReportSection[] = ['executive_summary', 'leads_overview', 'pipeline_status', 'goals_progress'];
+
+export const PDF_REPORT_PAGE_SIZE = 1000;
+
+const DAY_MS = 24 * 60 * 60 * 1000;
+const SALE_STATUSES = ['sold', 'reserved'];
+const CLOSED_STATUSES = ['sold', 'reserved', 'delivered'];
+const INACTIVE_STATUSES = ['sold', 'delivered', 'lost', 'inactive'];
+const DEFAULT_DEAL_VALUE = 2500000;
+const TOP_LIMIT = 10;
+const MISSING_RPC_CODES = ['PGRST202', '42883'];
+
+function keepTop<T>(items: T[], item: T, score: (i: T) => number): void {
+  items.push(item);
+  if (items.length > TOP_LIMIT) {
+    items.sort((a, b) => score(b) - score(a));
+    items.length = TOP_LIMIT;
+  }
+}
+
+export function createLeadStatsAccumulator() {
+  const stats: LeadStats = {
+    total: 0, assigned: 0, sales: 0, by_funnel: {},
+    closed: { count: 0, revenue: 0, avg_days: 0 },
+    sources: [], developments: [], vendors: [], hot: []
+  };
+  const sources = new Map<string, LeadStats['sources'][number]>();
+  const developments = new Map<string, LeadStats['developments'][number]>();
+  const vendors = new Map<string, LeadStats['vendors'][number]>();
+  let closedDays = 0;
+  let closedDaysCount = 0;
+
+  return {
+    add(lead: any): void {
+      const isSale = SALE_STATUSES.includes(lead.status);
+      const isClosed = CLOSED_STATUSES.includes(lead.status);
+      const budget = Number(lead.budget) || 0;
+
+      stats.total++;
+      if (isSale) stats.sales++;
+      const funnel = lead.funnel_status || 'new';
+      stats.by_funnel[funnel] = (stats.by_funnel[funnel] || 0) + 1;
+
+      if (isClosed) {
+        stats.closed.count++;
+        stats.closed.revenue += budget;
+        const days = Math.floor((new Date(lead.updated_at).getTime() - new Date(lead.created_at).getTime()) / DAY_MS);
+        if (!isNaN(days)) {
+          closedDays += days;
+          closedDaysCount++;
+        }
+      }
+
+      const source = lead.source || 'Directo';
+      let s = sources.get(source);
+      if (!s) sources.set(source, s = { source, count: 0, sold: 0 });
+      s.count++;
+      if (isSale) s.sold++;
+
+      const development = lead.property_interest || 'Sin especificar';
+      let d = developments.get(development);
+      if (!d) developments.set(development, d = { development, count: 0, sales: 0, closed: 0, revenue: 0 });
+      d.count++;
+      if (isSale) d.sales++;
+      if (isClosed) {
+        d.closed++;
+        d.revenue += budget;
+      }
+
+      if (lead.assigned_to) {
+        stats.assigned++;
+        let v = vendors.get(lead.assigned_to);
+        if (!v) vendors.set(lead.assigned_to, v = { assigned_to: lead.assigned_to, leads: 0, sales: 0, closed: 0, revenue: 0 });
+        v.leads++;
+        if (isSale) v.sales++;
+        if (isClosed) {
+          v.closed++;
+          v.revenue += budget;
+        }
+      }
+
+      if (lead.temperature === 'HOT' || (lead.score && Number(lead.score) >= 70)) {
+        keepTop(stats.hot, {
+          name: lead.name || 'Sin nombre',
+          score: Number(lead.score) || 0,
+          interest: lead.property_interest || 'No especificado'
+        }, h => h.score);
+      }
+    },
+
+    result(): LeadStats {
+      stats.closed.avg_days = closedDaysCount > 0 ? Math.round(closedDays / closedDaysCount) : 0;
+      stats.sources = [...sources.values()].sort((a, b) => b.count - a.count);
+      stats.developments = [...developments.values()].sort((a, b) => b.count - a.count);
+      stats.vendors = [...vendors.values()];
+      stats.hot.sort((a, b) => b.score - a.score);
+      return stats;
+    }
+  };
+}
+
+export function createPipelineAccumulator(now: number = Date.now()) {
+  const stats: PipelineStats = { total_value: 0, stages: [], expected_close_30d: 0, at_risk: [] };
+  const stages = new Map<string, PipelineStats['stages'][number]>();
+
+  return {
+    add(lead: any): void {
+      if (INACTIVE_STATUSES.includes(lead.status)) return;
+      const value = Number(lead.budget) || DEFAULT_DEAL_VALUE;
+      stats.total_value += value;
+
+      if (lead.funnel_status) {
+        let s = stages.get(lead.funnel_status);
+        if (!s) stages.set(lead.funnel_status, s = { stage: lead.funnel_status, count: 0, value: 0 });
+        s.count++;
+        s.value += value;
+      }
+      if (['negotiating', 'reserved'].includes(lead.funnel_status)) {
+        stats.expected_close_30d += value;
+      }
+
+      const daysSince = (now - new Date(lead.last_activity_at || lead.updated_at).getTime()) / DAY_MS;
+      if (daysSince > 7) {
+        keepTop(stats.at_risk, { name: lead.name || 'Sin nombre', days_stuck: Math.floor(daysSince) }, r => r.days_stuck);
+      }
+    },
+
+    result(): PipelineStats {
+      stats.stages = [...stages.values()];
+      stats.at_risk.sort((a, b) => b.days_stuck - a.days_stuck);
+      return stats;
+    }
+  };
+}
+
+export function createAppointmentStatsAccumulator() {
+  const stats: AppointmentStats = { scheduled: 0, completed: 0, no_show: 0, developments: [], vendors: [] };
+  const developments = new Map<string, AppointmentStats['developments'][number]>();
+  const vendors = new Map<string, AppointmentStats['vendors'][number]>();
+
+  return {
+    add(apt: any): void {
+      const completed = apt.status === 'completed';
+      stats.scheduled++;
+      if (completed) stats.completed++;
+      if (apt.status === 'no_show') stats.no_show++;
+
+      const development = apt.property_name || 'Sin especificar';
+      let d = developments.get(development);
+      if (!d) developments.set(development, d = { development, scheduled: 0, completed: 0 });
+      d.scheduled++;
+      if (completed) d.completed++;
+
+      if (apt.vendedor_id) {
+        let v = vendors.get(apt.vendedor_id);
+        if (!v) vendors.set(apt.vendedor_id, v = { vendedor_id: apt.vendedor_id, completed: 0 });
+        if (completed) v.completed++;
+      }
+    },
+
+    result(): AppointmentStats {
+      stats.developments = [...developments.values()].sort((a, b) => b.scheduled - a.scheduled);
+      stats.vendors = [...vendors.values()];
+      return stats;
+    }
+  };
+}
+
+type QueryRunner = <K extends ReportQueryName>(name: K) => Promise<ReportQueries[K]>;
+
 // ═══════════════════════════════════════════════════════════════════════════
 // SERVICE CLASS
 // ═══════════════════════════════════════════════════════════════════════════
@@ -128,118 +360,257 @@ export class PDFReportService {
       generated_at: new Date().toISOString()
     };
 
-    // Fetch data based on config
-    const startDate = new Date(config.start_date);
-    const endDate = new Date(config.end_date);
+    // Todas las secciones en paralelo; los agregados compartidos corren una vez
+    const query = this.createQueryRunner(config);
+    const sections = config.include_sections.filter(s => s !== 'recommendations');
+    const results = await Promise.all(sections.map(s => this.buildSection(s, query, config.vendor_id)));
+    for (const result of results) Object.assign(reportData, result);
 
-    // Get leads in period
-    const { data: leads } = await this.supabase.client
-      .from('leads')
-      .select('*')
-      .gte('created_at', startDate.toISOString())
-      .lte('created_at', endDate.toISOString());
-
-    const allLeads = leads || [];
-
-    // Get appointments
-    const { data: appointments } = await this.supabase.client
-      .from('appointments')
-      .select('*')
-      .gte('scheduled_date', startDate.toISOString().split('T')[0])
-      .lte('scheduled_date', endDate.toISOString().split('T')[0]);
-
-    const allAppointments = appointments || [];
-
-    // Get team members
-    const { data: team } = await this.supabase.client
-      .from('team_members')
-      .select('*')
-      .eq('active', true)
-      .eq('role', 'vendedor');
-
-    const teamMembers = team || [];
-
-    // Generate sections based on config
-    for (const section of config.include_sections) {
-      switch (section) {
-        case 'executive_summary':
-          reportData.summary = await this.generateExecutiveSummary(allLeads, allAppointments, startDate, endDate);
-          break;
-        case 'leads_overview':
-          reportData.leads = this.generateLeadsOverview(allLeads);
-          break;
-        case 'sales_metrics':
-          reportData.sales = await this.generateSalesMetrics(allLeads, teamMembers);
-          break;
-        case 'pipeline_status':
-          reportData.pipeline = this.generatePipelineStatus(allLeads);
-          break;
-        case 'team_performance':
-          reportData.team = await this.generateTeamPerformance(allLeads, allAppointments, teamMembers, config.vendor_id);
-          break;
-        case 'appointments':
-          reportData.appointments = this.generateAppointmentsSection(allAppointments);
-          break;
-        case 'goals_progress':
-          reportData.goals = await this.generateGoalsProgress(allLeads, teamMembers, startDate);
-          break;
-        case 'recommendations':
-          reportData.recommendations = this.generateRecommendations(reportData);
-          break;
-      }
+    if (config.include_sections.includes('recommendations')) {
+      reportData.recommendations = this.generateRecommendations(reportData);
     }
 
     return reportData;
   }
 
   // ═══════════════════════════════════════════════════════════════════════════
-  // EXECUTIVE SUMMARY
+  // STREAM HTML REPORT
+  // El <head> sale de inmediato; cada sección se emite en orden en cuanto su
+  // agregado está listo y se suelta. Solo se retiene lo que necesitan las
+  // recomendaciones.
   // ═══════════════════════════════════════════════════════════════════════════
 
-  private async generateExecutiveSummary(
-    leads: any[],
-    appointments: any[],
-    startDate: Date,
-    endDate: Date
-  ): Promise<ReportData['summary']> {
-    // Get previous period for comparison
-    const periodDays = Math.ceil((endDate.getTime() - startDate.getTime()) / (24 * 60 * 60 * 1000));
-    const prevStart = new Date(startDate.getTime() - periodDays * 24 * 60 * 60 * 1000);
+  streamHTML(config: ReportConfig): ReadableStream<Uint8Array> {
+    const encoder = new TextEncoder();
+    const generatedAt = new Date().toISOString();
+    const query = this.createQueryRunner(config);
+
+    const order = HTML_SECTION_ORDER.filter(s => config.include_sections.includes(s));
+    const wantsRecommendations = config.include_sections.includes('recommendations');
+    const extra = wantsRecommendations
+      ? RECOMMENDATION_INPUTS.filter(s => config.include_sections.includes(s) && !order.includes(s))
+      : [];
+
+    const pending = new Map<ReportSection, Promise<Partial<ReportData>>>();
+    for (const section of [...order, ...extra]) {
+      const promise = this.buildSection(section, query, config.vendor_id);
+      promise.catch(() => {}); // se reporta al consumirla
+      pending.set(section, promise);
+    }
+
+    const signals: ReportData = { config, generated_at: generatedAt };
+    let index = 0;
+
+    return new ReadableStream<Uint8Array>({
+      start: (controller) => {
+        controller.enqueue(encoder.encode(this.renderHTMLHead(config, generatedAt)));
+      },
+      pull: async (controller) => {
+        try {
+          if (index < order.length) {
+            const section = order[index++];
+            const data = await pending.get(section)!;
+            pending.delete(section);
+            controller.enqueue(encoder.encode(this.renderHTMLSection(section, { config, generated_at: generatedAt, ...data })));
+            if (wantsRecommendations && RECOMMENDATION_INPUTS.includes(section)) Object.assign(signals, data);
+            return;
+          }
+
+          if (wantsRecommendations) {
+            for (const section of extra) Object.assign(signals, await pending.get(section)!);
+            controller.enqueue(encoder.encode(this.renderHTMLRecommendations(this.generateRecommendations(signals))));
+          }
+          controller.enqueue(encoder.encode(this.renderHTMLFooter()));
+          controller.close();
+        } catch (e) {
+          console.error('❌ Error generando reporte HTML:', e);
+          controller.error(e);
+        }
+      }
+    });
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // QUERY RUNNER
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  private createQueryRunner(config: ReportConfig): QueryRunner {
+    const startDate = new Date(config.start_date);
+    const endDate = new Date(config.end_date);
+    const running = new Map<ReportQueryName, Promise<any>>();
+
+    return (name) => {
+      let promise = running.get(name);
+      if (!promise) {
+        promise = this.runQuery(name, startDate, endDate);
+        running.set(name, promise);
+      }
+      return promise;
+    };
+  }
+
+  private async runQuery(name: ReportQueryName, startDate: Date, endDate: Date): Promise<any> {
+    const client = this.supabase.client;
+    const fromDay = startDate.toISOString().split('T')[0];
+    const toDay = endDate.toISOString().split('T')[0];
+
+    switch (name) {
+      case 'lead_stats': {
+        const stats = await this.rpcAggregate<LeadStats>('pdf_report_lead_stats', { p_start: startDate.toISOString(), p_end: endDate.toISOString() });
+        if (stats) return stats;
+        const acc = createLeadStatsAccumulator();
+        await this.foldPages(
+          () => client.from('leads')
+            .select('name, status, funnel_status, source, property_interest, assigned_to, budget, score, temperature, created_at, updated_at')
+            .gte('created_at', startDate.toISOString())
+            .lte('created_at', endDate.toISOString()),
+          acc.add
+        );
+        return acc.result();
+      }
+
+      case 'pipeline': {
+        const stats = await this.rpcAggregate<PipelineStats>('pdf_report_pipeline', { p_start: startDate.toISOString(), p_end: endDate.toISOString() });
+        if (stats) return stats;
+        const acc = createPipelineAccumulator();
+        await this.foldPages(
+          () => client.from('leads')
+            .select('name, status, funnel_status, budget, last_activity_at, updated_at')
+            .gte('created_at', startDate.toISOString())
+            .lte('created_at', endDate.toISOString()),
+          acc.add
+        );
+        return acc.result();
+      }
+
+      case 'appointment_stats': {
+        const stats = await this.rpcAggregate<AppointmentStats>('pdf_report_appointment_stats', { p_from: fromDay, p_to: toDay });
+        if (stats) return stats;
+        const acc = createAppointmentStatsAccumulator();
+        await this.foldPages(
+          () => client.from('appointments')
+            .select('status, vendedor_id, property_name')
+            .gte('scheduled_date', fromDay)
+            .lte('scheduled_date', toDay),
+          acc.add
+        );
+        return acc.result();
+      }
+
+      case 'prev_sales': {
+        // Periodo anterior de la misma duración (solo el conteo)
+        const periodDays = Math.ceil((endDate.getTime() - startDate.getTime()) / DAY_MS);
+        const prevStart = new Date(startDate.getTime() - periodDays * DAY_MS);
+        const { count } = await client
+          .from('leads')
+          .select('id', { count: 'exact', head: true })
+          .gte('created_at', prevStart.toISOString())
+          .lt('created_at', startDate.toISOString())
+          .in('status', SALE_STATUSES);
+        return count || 0;
+      }
+
+      case 'team': {
+        const { data: team } = await client
+          .from('team_members')
+          .select('id, name')
+          .eq('active', true)
+          .eq('role', 'vendedor');
+        return team || [];
+      }
+
+      case 'goals': {
+        const monthKey = startDate.toISOString().slice(0, 7);
+        const [{ data: companyGoal }, { data: vendorGoals }] = await Promise.all([
+          client.from('monthly_goals').select('company_goal').eq('month', monthKey).single(),
+          client.from('vendor_monthly_goals').select('vendor_id, goal').eq('month', monthKey)
+        ]);
+        return { company_goal: companyGoal?.company_goal || null, vendor_goals: vendorGoals || [] };
+      }
+    }
+  }
 
-    const { data: prevLeads } = await this.supabase.client
-      .from('leads')
-      .select('id, status')
-      .gte('created_at', prevStart.toISOString())
-      .lt('created_at', startDate.toISOString());
+  private async rpcAggregate<T>(fn: string, params: Record<string, any>): Promise<T | null> {
+    const { data, error } = await this.supabase.client.rpc(fn, params);
+    if (error) {
+      // Sin migración 014 se acumula en el worker
+      if (!MISSING_RPC_CODES.includes(error.code)) console.error(`⚠️ ${fn} falló, acumulando en worker:`, error.message);
+      return null;
+    }
+    return (data as T) || null;
+  }
 
-    const prevPeriod = prevLeads || [];
+  private async foldPages(buildQuery: () => any, add: (row: any) => void): Promise<void> {
+    for (let offset = 0; ; offset += PDF_REPORT_PAGE_SIZE) {
+      const { data, error } = await buildQuery()
+        .order('id', { ascending: true })
+        .range(offset, offset + PDF_REPORT_PAGE_SIZE - 1);
+      if (error) {
+        console.error('⚠️ Error leyendo página de reporte:', error.message);
+        return;
+      }
+      const rows = data || [];
+      for (const row of rows) add(row);
+      if (rows.length < PDF_REPORT_PAGE_SIZE) return;
+    }
+  }
 
-    const newLeads = leads.filter(l => l.funnel_status === 'new').length;
-    const qualified = leads.filter(l => ['qualified', 'visit_scheduled', 'visited', 'negotiating'].includes(l.funnel_status)).length;
-    const soldLeads = leads.filter(l => ['sold', 'reserved', 'delivered'].includes(l.status));
-    const salesClosed = soldLeads.length;
-    const totalRevenue = soldLeads.reduce((sum, l) => sum + (Number(l.budget) || 0), 0);
+  // ═══════════════════════════════════════════════════════════════════════════
+  // SECTION DISPATCH
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  private async buildSection(section: ReportSection, query: QueryRunner, vendorId?: string): Promise<Partial<ReportData>> {
+    const q = {} as ReportQueries;
+    await Promise.all(SECTION_QUERIES[section].map(async name => {
+      (q as any)[name] = await query(name);
+    }));
+
+    switch (section) {
+      case 'executive_summary':
+        return { summary: this.generateExecutiveSummary(q) };
+      case 'leads_overview':
+        return { leads: this.generateLeadsOverview(q) };
+      case 'sales_metrics':
+        return { sales: this.generateSalesMetrics(q) };
+      case 'pipeline_status':
+        return { pipeline: this.generatePipelineStatus(q) };
+      case 'team_performance':
+        return { team: this.generateTeamPerformance(q, vendorId) };
+      case 'appointments':
+        return { appointments: this.generateAppointmentsSection(q) };
+      case 'goals_progress':
+        return { goals: this.generateGoalsProgress(q) };
+      default:
+        return {};
+    }
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // EXECUTIVE SUMMARY
+  // ═══════════════════════════════════════════════════════════════════════════
 
-    const aptsScheduled = appointments.length;
-    const aptsCompleted = appointments.filter(a => a.status === 'completed').length;
+  private generateExecutiveSummary({ lead_stats: stats, appointment_stats: apts, prev_sales: prevSales }: ReportQueries): ReportData['summary'] {
+    const newLeads = stats.by_funnel['new'] || 0;
+    const qualified = ['qualified', 'visit_scheduled', 'visited', 'negotiating']
+      .reduce((sum, s) => sum + (stats.by_funnel[s] || 0), 0);
+    const salesClosed = stats.closed.count;
 
-    const prevSales = prevPeriod.filter(l => ['sold', 'reserved'].includes(l.status)).length;
     const changePercent = prevSales > 0
       ? Math.round(((salesClosed - prevSales) / prevSales) * 100)
       : salesClosed > 0 ? 100 : 0;
 
-    const conversionRate = leads.length > 0
-      ? ((salesClosed / leads.length) * 100).toFixed(1) + '%'
+    const conversionRate = stats.total > 0
+      ? ((salesClosed / stats.total) * 100).toFixed(1) + '%'
       : '0%';
 
     return {
-      total_leads: leads.length,
+      total_leads: stats.total,
       new_leads: newLeads,
       qualified_leads: qualified,
-      appointments_scheduled: aptsScheduled,
-      appointments_completed: aptsCompleted,
+      appointments_scheduled: apts.scheduled,
+      appointments_completed: apts.completed,
       sales_closed: salesClosed,
-      total_revenue: totalRevenue,
+      total_revenue: stats.closed.revenue,
       conversion_rate: conversionRate,
       comparison_vs_previous: `${changePercent >= 0 ? '+' : ''}${changePercent}% vs periodo anterior`
     };
@@ -249,17 +620,10 @@ export class PDFReportService {
   // LEADS OVERVIEW
   // ═══════════════════════════════════════════════════════════════════════════
 
-  private generateLeadsOverview(leads: any[]): ReportData['leads'] {
-    const total = leads.length || 1;
+  private generateLeadsOverview({ lead_stats: stats }: ReportQueries): ReportData['leads'] {
+    const total = stats.total || 1;
 
-    // By status
-    const statusCount: Record<string, number> = {};
-    for (const lead of leads) {
-      const status = lead.funnel_status || 'new';
-      statusCount[status] = (statusCount[status] || 0) + 1;
-    }
-
-    const byStatus = Object.entries(statusCount)
+    const byStatus = Object.entries(stats.by_funnel)
       .map(([status, count]) => ({
         status: this.translateStatus(status),
         count,
@@ -267,60 +631,21 @@ export class PDFReportService {
       }))
       .sort((a, b) => b.count - a.count);
 
-    // By source
-    const sourceStats: Record<string, { count: number; sold: number }> = {};
-    for (const lead of leads) {
-      const source = lead.source || 'Directo';
-      if (!sourceStats[source]) sourceStats[source] = { count: 0, sold: 0 };
-      sourceStats[source].count++;
-      if (['sold', 'reserved'].includes(lead.status)) {
-        sourceStats[source].sold++;
-      }
-    }
-
-    const bySource = Object.entries(sourceStats)
-      .map(([source, stats]) => ({
-        source,
-        count: stats.count,
-        conversion: stats.count > 0 ? ((stats.sold / stats.count) * 100).toFixed(1) + '%' : '0%'
-      }))
-      .sort((a, b) => b.count - a.count);
+    const bySource = stats.sources.map(s => ({
+      source: s.source,
+      count: s.count,
+      conversion: s.count > 0 ? ((s.sold / s.count) * 100).toFixed(1) + '%' : '0%'
+    }));
 
-    // By development
-    const devStats: Record<string, { count: number; sales: number }> = {};
-    for (const lead of leads) {
-      const dev = lead.property_interest || 'Sin especificar';
-      if (!devStats[dev]) devStats[dev] = { count: 0, sales: 0 };
-      devStats[dev].count++;
-      if (['sold', 'reserved'].includes(lead.status)) {
-        devStats[dev].sales++;
-      }
-    }
-
-    const byDevelopment = Object.entries(devStats)
-      .map(([development, stats]) => ({
-        development,
-        count: stats.count,
-        sales: stats.sales
-      }))
-      .sort((a, b) => b.count - a.count)
-      .slice(0, 10);
-
-    // Hot leads
-    const hotLeads = leads
-      .filter(l => l.temperature === 'HOT' || (l.score && Number(l.score) >= 70))
+    const byDevelopment = stats.developments
       .slice(0, 10)
-      .map(l => ({
-        name: l.name || 'Sin nombre',
-        score: Number(l.score) || 0,
-        interest: l.property_interest || 'No especificado'
-      }));
+      .map(d => ({ development: d.development, count: d.count, sales: d.sales }));
 
     return {
       by_status: byStatus,
       by_source: bySource,
       by_development: byDevelopment,
-      hot_leads: hotLeads
+      hot_leads: stats.hot
     };
   }
 
@@ -328,61 +653,26 @@ export class PDFReportService {
   // SALES METRICS
   // ═══════════════════════════════════════════════════════════════════════════
 
-  private async generateSalesMetrics(leads: any[], teamMembers: any[]): Promise<ReportData['sales']> {
-    const soldLeads = leads.filter(l => ['sold', 'reserved', 'delivered'].includes(l.status));
-    const revenue = soldLeads.reduce((sum, l) => sum + (Number(l.budget) || 0), 0);
-    const avgDealSize = soldLeads.length > 0 ? Math.round(revenue / soldLeads.length) : 0;
-
-    // Days to close
-    const daysToClose = soldLeads.map(l => {
-      const created = new Date(l.created_at).getTime();
-      const closed = new Date(l.updated_at).getTime();
-      return Math.floor((closed - created) / (24 * 60 * 60 * 1000));
-    });
-    const avgDaysToClose = daysToClose.length > 0
-      ? Math.round(daysToClose.reduce((a, b) => a + b, 0) / daysToClose.length)
-      : 0;
+  private generateSalesMetrics({ lead_stats: stats, team }: ReportQueries): ReportData['sales'] {
+    const { count, revenue, avg_days } = stats.closed;
+    const names = new Map(team.map(t => [t.id, t.name]));
 
-    // Top performers
-    const salesByVendor: Record<string, { name: string; sales: number; revenue: number }> = {};
-    for (const lead of soldLeads) {
-      if (lead.assigned_to) {
-        const vendor = teamMembers.find(t => t.id === lead.assigned_to);
-        const name = vendor?.name || 'Desconocido';
-        if (!salesByVendor[lead.assigned_to]) {
-          salesByVendor[lead.assigned_to] = { name, sales: 0, revenue: 0 };
-        }
-        salesByVendor[lead.assigned_to].sales++;
-        salesByVendor[lead.assigned_to].revenue += Number(lead.budget) || 0;
-      }
-    }
-
-    const topPerformers = Object.values(salesByVendor)
+    const topPerformers = stats.vendors
+      .filter(v => v.closed > 0)
+      .map(v => ({ name: names.get(v.assigned_to) || 'Desconocido', sales: v.closed, revenue: v.revenue }))
       .sort((a, b) => b.sales - a.sales)
       .slice(0, 5);
 
-    // By development
-    const salesByDev: Record<string, { sales: number; revenue: number }> = {};
-    for (const lead of soldLeads) {
-      const dev = lead.property_interest || 'Sin especificar';
-      if (!salesByDev[dev]) salesByDev[dev] = { sales: 0, revenue: 0 };
-      salesByDev[dev].sales++;
-      salesByDev[dev].revenue += Number(lead.budget) || 0;
-    }
-
-    const byDevelopment = Object.entries(salesByDev)
-      .map(([development, stats]) => ({
-        development,
-        sales: stats.sales,
-        revenue: stats.revenue
-      }))
+    const byDevelopment = stats.developments
+      .filter(d => d.closed > 0)
+      .map(d => ({ development: d.development, sales: d.closed, revenue: d.revenue }))
       .sort((a, b) => b.revenue - a.revenue);
 
     return {
-      closed_count: soldLeads.length,
+      closed_count: count,
       revenue,
-      avg_deal_size: avgDealSize,
-      days_to_close: avgDaysToClose,
+      avg_deal_size: count > 0 ? Math.round(revenue / count) : 0,
+      days_to_close: avg_days,
       top_performers: topPerformers,
       by_development: byDevelopment
     };
@@ -392,52 +682,24 @@ export class PDFReportService {
   // PIPELINE STATUS
   // ═══════════════════════════════════════════════════════════════════════════
 
-  private generatePipelineStatus(leads: any[]): ReportData['pipeline'] {
-    const activeLeads = leads.filter(l =>
-      !['sold', 'delivered', 'lost', 'inactive'].includes(l.status)
-    );
-
-    const totalValue = activeLeads.reduce((sum, l) => sum + (Number(l.budget) || 2500000), 0);
-
-    // By stage
+  private generatePipelineStatus({ pipeline }: ReportQueries): ReportData['pipeline'] {
     const stages = ['new', 'contacted', 'qualified', 'visit_scheduled', 'visited', 'negotiating', 'reserved'];
-    const byStage = stages.map(stage => {
-      const stageLeads = activeLeads.filter(l => l.funnel_status === stage);
-      return {
-        stage: this.translateStatus(stage),
-        count: stageLeads.length,
-        value: stageLeads.reduce((sum, l) => sum + (Number(l.budget) || 2500000), 0)
-      };
-    }).filter(s => s.count > 0);
-
-    // Expected close in 30 days
-    const expected30d = activeLeads
-      .filter(l => ['negotiating', 'reserved'].includes(l.funnel_status))
-      .reduce((sum, l) => sum + (Number(l.budget) || 2500000), 0);
-
-    // At risk leads (stuck more than 7 days)
-    const now = Date.now();
-    const atRisk = activeLeads
-      .filter(l => {
-        const lastActivity = new Date(l.last_activity_at || l.updated_at).getTime();
-        const daysSince = (now - lastActivity) / (24 * 60 * 60 * 1000);
-        return daysSince > 7;
+    const byStage = stages
+      .map(stage => {
+        const s = pipeline.stages.find(p => p.stage === stage);
+        return { stage: this.translateStatus(stage), count: s?.count || 0, value: s?.value || 0 };
       })
-      .slice(0, 10)
-      .map(l => {
-        const daysSince = Math.floor((now - new Date(l.last_activity_at || l.updated_at).getTime()) / (24 * 60 * 60 * 1000));
-        return {
-          name: l.name || 'Sin nombre',
-          reason: daysSince > 14 ? 'Sin contacto' : 'Estancado',
-          days_stuck: daysSince
-        };
-      });
+      .filter(s => s.count > 0);
 
     return {
-      total_value: totalValue,
+      total_value: pipeline.total_value,
       by_stage: byStage,
-      expected_close_30d: expected30d,
-      at_risk: atRisk
+      expected_close_30d: pipeline.expected_close_30d,
+      at_risk: pipeline.at_risk.map(l => ({
+        name: l.name,
+        reason: l.days_stuck > 14 ? 'Sin contacto' : 'Estancado',
+        days_stuck: l.days_stuck
+      }))
     };
   }
 
@@ -445,33 +707,27 @@ export class PDFReportService {
   // TEAM PERFORMANCE
   // ═══════════════════════════════════════════════════════════════════════════
 
-  private async generateTeamPerformance(
-    leads: any[],
-    appointments: any[],
-    teamMembers: any[],
+  private generateTeamPerformance(
+    { lead_stats: stats, appointment_stats: apts, team }: ReportQueries,
     vendorId?: string
-  ): Promise<ReportData['team']> {
+  ): ReportData['team'] {
     const membersToAnalyze = vendorId
-      ? teamMembers.filter(t => t.id === vendorId)
-      : teamMembers;
-
-    const byMember = membersToAnalyze.map(member => {
-      const memberLeads = leads.filter(l => l.assigned_to === member.id);
-      const memberApts = appointments.filter(a => a.vendor_id === member.id);
-      const memberSales = memberLeads.filter(l => ['sold', 'reserved'].includes(l.status));
-
-      return {
-        name: member.name,
-        leads: memberLeads.length,
-        appointments: memberApts.filter(a => a.status === 'completed').length,
-        sales: memberSales.length,
-        response_time: 'N/A' // Would need more detailed tracking
-      };
-    }).sort((a, b) => b.sales - a.sales);
+      ? team.filter(t => t.id === vendorId)
+      : team;
+    const leadsByVendor = new Map(stats.vendors.map(v => [v.assigned_to, v]));
+    const aptsByVendor = new Map(apts.vendors.map(v => [v.vendedor_id, v.completed]));
+
+    const byMember = membersToAnalyze.map(member => ({
+      name: member.name,
+      leads: leadsByVendor.get(member.id)?.leads || 0,
+      appointments: aptsByVendor.get(member.id) || 0,
+      sales: leadsByVendor.get(member.id)?.sales || 0,
+      response_time: 'N/A' // Would need more detailed tracking
+    })).sort((a, b) => b.sales - a.sales);
 
     return {
       active_members: membersToAnalyze.length,
-      total_leads_handled: leads.filter(l => l.assigned_to).length,
+      total_leads_handled: stats.assigned,
       avg_response_time: 'N/A',
       by_member: byMember
     };
@@ -481,35 +737,16 @@ export class PDFReportService {
   // APPOINTMENTS SECTION
   // ═══════════════════════════════════════════════════════════════════════════
 
-  private generateAppointmentsSection(appointments: any[]): ReportData['appointments'] {
-    const completed = appointments.filter(a => a.status === 'completed').length;
-    const noShow = appointments.filter(a => a.status === 'no_show').length;
-    const noShowRate = appointments.length > 0
-      ? ((noShow / appointments.length) * 100).toFixed(1) + '%'
+  private generateAppointmentsSection({ appointment_stats: apts }: ReportQueries): ReportData['appointments'] {
+    const noShowRate = apts.scheduled > 0
+      ? ((apts.no_show / apts.scheduled) * 100).toFixed(1) + '%'
       : '0%';
 
-    // By development
-    const devStats: Record<string, { scheduled: number; completed: number }> = {};
-    for (const apt of appointments) {
-      const dev = apt.development || apt.property_interest || 'Sin especificar';
-      if (!devStats[dev]) devStats[dev] = { scheduled: 0, completed: 0 };
-      devStats[dev].scheduled++;
-      if (apt.status === 'completed') devStats[dev].completed++;
-    }
-
-    const byDevelopment = Object.entries(devStats)
-      .map(([development, stats]) => ({
-        development,
-        scheduled: stats.scheduled,
-        completed: stats.completed
-      }))
-      .sort((a, b) => b.scheduled - a.scheduled);
-
     return {
-      scheduled: appointments.length,
-      completed,
+      scheduled: apts.scheduled,
+      completed: apts.completed,
       no_show_rate: noShowRate,
-      by_development: byDevelopment
+      by_development: apts.developments
     };
   }
 
@@ -517,22 +754,9 @@ export class PDFReportService {
   // GOALS PROGRESS
   // ═══════════════════════════════════════════════════════════════════════════
 
-  private async generateGoalsProgress(
-    leads: any[],
-    teamMembers: any[],
-    periodStart: Date
-  ): Promise<ReportData['goals']> {
-    const monthKey = periodStart.toISOString().slice(0, 7);
-
-    // Get company goal
-    const { data: companyGoal } = await this.supabase.client
-      .from('monthly_goals')
-      .select('company_goal')
-      .eq('month', monthKey)
-      .single();
-
-    const goal = companyGoal?.company_goal || 5;
-    const currentSales = leads.filter(l => ['sold', 'reserved'].includes(l.status)).length;
+  private generateGoalsProgress({ lead_stats: stats, team, goals }: ReportQueries): ReportData['goals'] {
+    const goal = goals.company_goal || 5;
+    const currentSales = stats.sales;
     const progressPercent = ((currentSales / goal) * 100).toFixed(1) + '%';
 
     // Days progress in month
@@ -548,17 +772,10 @@ export class PDFReportService {
       projected >= goal ? 'on_track' :
       projected >= goal * 0.8 ? 'at_risk' : 'behind';
 
-    // By vendor
-    const { data: vendorGoals } = await this.supabase.client
-      .from('vendor_monthly_goals')
-      .select('vendor_id, goal')
-      .eq('month', monthKey);
-
-    const byVendor = teamMembers.map(member => {
-      const vendorGoal = vendorGoals?.find(vg => vg.vendor_id === member.id)?.goal || 1;
-      const vendorSales = leads.filter(l =>
-        l.assigned_to === member.id && ['sold', 'reserved'].includes(l.status)
-      ).length;
+    const salesByVendor = new Map(stats.vendors.map(v => [v.assigned_to, v.sales]));
+    const byVendor = team.map(member => {
+      const vendorGoal = goals.vendor_goals.find(vg => vg.vendor_id === member.id)?.goal || 1;
+      const vendorSales = salesByVendor.get(member.id) || 0;
 
       return {
         name: member.name,
@@ -688,15 +905,23 @@ export class PDFReportService {
 
   // ═══════════════════════════════════════════════════════════════════════════
   // GENERATE HTML REPORT (for PDF conversion)
+  // Mismos fragmentos que streamHTML, concatenados en memoria
   // ═══════════════════════════════════════════════════════════════════════════
 
   generateHTML(data: ReportData): string {
+    return this.renderHTMLHead(data.config, data.generated_at)
+      + HTML_SECTION_ORDER.map(section => this.renderHTMLSection(section, data)).join('')
+      + this.renderHTMLRecommendations(data.recommendations)
+      + this.renderHTMLFooter();
+  }
+
+  private renderHTMLHead(config: ReportConfig, generatedAt: string): string {
     return `
 <!DOCTYPE html>
 <html>
 <head>
   <meta charset="UTF-8">
-  <title>${data.config.title}</title>
+  <title>${config.title}</title>
   <style>
     body { font-family: Arial, sans-serif; margin: 40px; color: #333; }
     h1 { color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px; }
@@ -718,11 +943,16 @@ export class PDFReportService {
   </style>
 </head>
 <body>
-  <h1>${data.config.title}</h1>
-  <p><strong>Periodo:</strong> ${this.formatDate(data.config.start_date)} - ${this.formatDate(data.config.end_date)}</p>
-  <p><strong>Generado:</strong> ${new Date(data.generated_at).toLocaleString('es-MX')}</p>
+  <h1>${config.title}</h1>
+  <p><strong>Periodo:</strong> ${this.formatDate(config.start_date)} - ${this.formatDate(config.end_date)}</p>
+  <p><strong>Generado:</strong> ${new Date(generatedAt).toLocaleString('es-MX')}</p>
+`;
+  }
 
-  ${data.summary ? `
+  private renderHTMLSection(section: ReportSection, data: ReportData): string {
+    switch (section) {
+      case 'executive_summary':
+        return data.summary ? `
   <h2>Resumen Ejecutivo</h2>
   <div class="summary-grid">
     <div class="metric-card">
@@ -750,9 +980,10 @@ export class PDFReportService {
       <div class="metric-label">vs Periodo Anterior</div>
     </div>
   </div>
-  ` : ''}
+` : '';
 
-  ${data.sales && data.sales.top_performers.length > 0 ? `
+      case 'sales_metrics':
+        return data.sales && data.sales.top_performers.length > 0 ? `
   <h2>Top Vendedores</h2>
   <table>
     <tr><th>Vendedor</th><th>Ventas</th><th>Revenue</th></tr>
@@ -760,18 +991,20 @@ export class PDFReportService {
     <tr><td>${p.name}</td><td>${p.sales}</td><td>$${this.formatNumber(p.revenue)}</td></tr>
     `).join('')}
   </table>
-  ` : ''}
+` : '';
 
-  ${data.goals ? `
+      case 'goals_progress':
+        return data.goals ? `
   <h2>Avance de Meta</h2>
   <p class="status-${data.goals.status}">
     <strong>${data.goals.current_sales}</strong> de <strong>${data.goals.company_goal}</strong> ventas
     (${data.goals.progress_percent})
   </p>
   <p>Proyección fin de mes: ${data.goals.projected_end_month} ventas</p>
-  ` : ''}
+` : '';
 
-  ${data.pipeline ? `
+      case 'pipeline_status':
+        return data.pipeline ? `
   <h2>Pipeline</h2>
   <p><strong>Valor Total:</strong> $${this.formatNumber(data.pipeline.total_value)}</p>
   <p><strong>Cierre esperado 30 días:</strong> $${this.formatNumber(data.pipeline.expected_close_30d)}</p>
@@ -784,23 +1017,32 @@ export class PDFReportService {
     `).join('')}
   </table>
   ` : ''}
-  ` : ''}
+` : '';
 
-  ${data.recommendations && data.recommendations.length > 0 ? `
+      default:
+        return '';
+    }
+  }
+
+  private renderHTMLRecommendations(recommendations?: string[]): string {
+    return recommendations && recommendations.length > 0 ? `
   <div class="recommendations">
     <h2>Recomendaciones</h2>
     <ul>
-      ${data.recommendations.map(r => `<li>${r}</li>`).join('')}
+      ${recommendations.map(r => `<li>${r}</li>`).join('')}
     </ul>
   </div>
-  ` : ''}
+` : '';
+  }
 
+  private renderHTMLFooter(): string {
+    return `
   <div class="footer">
     <p>Reporte generado por SARA CRM - ${new Date().getFullYear()}</p>
   </div>
 </body>
 </html>
-    `;
+`;
   }
 
   // ═══════════════════════════════════════════════════════════════════════════
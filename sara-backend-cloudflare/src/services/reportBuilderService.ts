@@ -53,16 +53,142 @@ export interface ReportSnapshot {
   generated_at: string;
 }
 
-const NUMERIC_FIELDS: Record<string, string[]> = {
+export const NUMERIC_FIELDS: Record<string, string[]> = {
   leads: ['score', 'budget_min', 'budget_max'],
   appointments: ['duration_minutes'],
   tasks: ['priority_order'],
   communications: ['message_count'],
 };
 
+// Columnas permitidas como dimensión / filtro (se interpolan como identificador en SQL).
+// report_aggregate (migración 013) repite ambos whitelists: mantenerlos iguales.
+export const REPORT_DIMENSIONS: Record<string, string[]> = {
+  leads: ['status', 'source', 'property_interest', 'assigned_to', 'funnel_status', 'lost_reason', 'preferred_channel'],
+  appointments: ['status', 'vendedor_id', 'property_id', 'scheduled_date'],
+  tasks: ['status', 'priority', 'task_type', 'assigned_to'],
+  communications: ['channel', 'direction', 'status', 'team_member_id'],
+};
+
+const REPORT_METRICS: ReportMetric[] = ['count', 'sum', 'avg', 'min', 'max'];
+const MISSING_RPC_CODES = ['PGRST202', '42883'];
+export const REPORT_PAGE_SIZE = 1000;
+
+// --- QUERY PLANNER ---
+
+export interface ReportPlan {
+  entity: ReportConfig['entity'];
+  dimensions: string[];
+  metrics: { fn: ReportMetric; field?: string }[];
+  filters: { field: string; op: 'eq' | 'in' | 'is_null'; value?: any }[];
+  date_from?: string;
+  date_to?: string;
+  sort?: { key: string; desc: boolean };
+  limit?: number;
+  offset?: number;
+  totals?: boolean;
+}
+
+/** Columnas de salida del plan, en orden: dimensiones y luego alias de métricas */
+export function planColumns(plan: ReportPlan): string[] {
+  return [...plan.dimensions, ...plan.metrics.map(m => m.fn === 'count' ? 'count' : `${m.fn}_${m.field}`)];
+}
+
+/** Valida un ReportConfig contra los whitelists. Devuelve el error o null */
+export function validateReportConfig(config: ReportConfig): string | null {
+  if (!config || !Object.prototype.hasOwnProperty.call(NUMERIC_FIELDS, config.entity)) return `Entidad no permitida: ${config?.entity}`;
+  const allowed = REPORT_DIMENSIONS[config.entity];
+  const metrics = config.metrics || [];
+  for (const metric of metrics) {
+    if (!REPORT_METRICS.includes(metric)) return `Métrica no permitida: ${metric}`;
+  }
+  for (const dim of config.dimensions || []) {
+    if (!allowed.includes(dim)) return `Dimensión no permitida: ${dim}`;
+  }
+  for (const field of Object.keys(config.filters || {})) {
+    if (!allowed.includes(field)) return `Filtro no permitido: ${field}`;
+  }
+  if (config.sort) {
+    const plan = planReport({ ...config, sort: undefined });
+    if (!planColumns(plan).includes(config.sort.field)) return `Orden no permitido: ${config.sort.field}`;
+  }
+  return null;
+}
+
+/**
+ * Compila un ReportConfig (ya validado) a un plan para report_aggregate.
+ * Cada métrica no-count se expande a los NUMERIC_FIELDS de la entidad.
+ */
+export function planReport(config: ReportConfig): ReportPlan {
+  const numFields = NUMERIC_FIELDS[config.entity] || [];
+  const metrics: ReportPlan['metrics'] = [];
+  for (const metric of config.metrics || []) {
+    if (metric === 'count') metrics.push({ fn: 'count' });
+    else for (const field of numFields) metrics.push({ fn: metric, field });
+  }
+
+  const filters: ReportPlan['filters'] = Object.entries(config.filters || {}).map(([field, value]) => {
+    if (value === null) return { field, op: 'is_null' as const };
+    if (Array.isArray(value)) return { field, op: 'in' as const, value: value.map(String) };
+    return { field, op: 'eq' as const, value: String(value) };
+  });
+
+  const plan: ReportPlan = { entity: config.entity, dimensions: config.dimensions || [], metrics, filters };
+  if (config.date_range?.from) plan.date_from = config.date_range.from;
+  if (config.date_range?.to) plan.date_to = config.date_range.to;
+  if (config.sort) plan.sort = { key: config.sort.field, desc: config.sort.direction === 'desc' };
+  if (config.limit && config.limit > 0) plan.limit = config.limit;
+  return plan;
+}
+
+/** SHA-256 del plan: dos configs equivalentes comparten snapshot */
+export async function hashReportPlan(plan: ReportPlan): Promise<string> {
+  const bytes = new TextEncoder().encode(JSON.stringify(plan));
+  const digest = await crypto.subtle.digest('SHA-256', bytes);
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+function emptyResult(): ReportResult {
+  return { rows: [], totals: {}, row_count: 0, generated_at: new Date().toISOString() };
+}
+
+/**
+ * Ejecuta el plan en la base (un solo SELECT ... GROUP BY vía RPC).
+ * null si el RPC no está disponible (migración 013 sin aplicar).
+ */
+async function runAggregate(supabase: SupabaseService, plan: ReportPlan): Promise<{ rows: Record<string, any>[]; totals: Record<string, number> } | null> {
+  const { data, error } = await supabase.client.rpc('report_aggregate', { p_plan: plan });
+  if (error) {
+    if (!MISSING_RPC_CODES.includes(error.code)) throw new Error(error.message);
+    return null;
+  }
+  if (!data) return null;
+  return { rows: data.rows || [], totals: data.totals || {} };
+}
+
 // --- BUILD REPORT ---
 
 export async function buildReport(supabase: SupabaseService, config: ReportConfig): Promise<ReportResult> {
+  const invalid = validateReportConfig(config);
+  if (invalid) {
+    console.error('reportBuilder: config inválido', invalid);
+    return emptyResult();
+  }
+
+  try {
+    const aggregated = await runAggregate(supabase, planReport(config));
+    if (aggregated) {
+      return { rows: aggregated.rows, totals: aggregated.totals, row_count: aggregated.rows.length, generated_at: new Date().toISOString() };
+    }
+  } catch (e) {
+    // Error del RPC (no solo ausente): se recalcula en el worker en vez de devolver vacío
+    console.error('reportBuilder: report_aggregate error, usando worker', e instanceof Error ? e.message : e);
+  }
+
+  return buildReportInWorker(supabase, config);
+}
+
+/** Respaldo sin la migración 013: trae filas y agrega en el worker */
+async function buildReportInWorker(supabase: SupabaseService, config: ReportConfig): Promise<ReportResult> {
   const { entity, metrics, dimensions, filters, date_range, sort, limit } = config;
 
   let query = supabase.client.from(entity).select('*').eq('tenant_id', supabase.getTenantId());
@@ -80,7 +206,7 @@ export async function buildReport(supabase: SupabaseService, config: ReportConfi
   const { data: rows, error } = await query;
   if (error) {
     console.error('reportBuilder: query error', error.message);
-    return { rows: [], totals: {}, row_count: 0, generated_at: new Date().toISOString() };
+    return emptyResult();
   }
 
   const allRows = rows || [];
@@ -233,16 +359,143 @@ export async function getSnapshots(supabase: SupabaseService, reportId: string,
   return data || [];
 }
 
+export interface SavedReportRun {
+  data: ReportResult;
+  cached: boolean; // true = snapshot reutilizado (mismo plan, sin cambios en la entidad)
+  snapshot_id: string | null;
+}
+
+/**
+ * Ejecuta un reporte guardado en una sola llamada (report_run_snapshot): si
+ * el plan y la marca de agua de la entidad no cambiaron desde el último
+ * snapshot, se devuelve ese snapshot; si no, se agrega y se guarda uno nuevo.
+ */
+export async function runSavedReport(supabase: SupabaseService, report: SavedReport, options: { force?: boolean } = {}): Promise<SavedReportRun> {
+  const invalid = validateReportConfig(report.config);
+  if (invalid) {
+    console.error(`reportBuilder: reporte ${report.id} inválido`, invalid);
+    return { data: emptyResult(), cached: false, snapshot_id: null };
+  }
+
+  const plan = planReport(report.config);
+  const { data, error } = await supabase.client.rpc('report_run_snapshot', {
+    p_report_id: report.id,
+    p_plan: plan,
+    p_config_hash: await hashReportPlan(plan),
+    p_force: options.force === true,
+  });
+
+  if (!error && data) {
+    return { data: data.data, cached: data.cached === true, snapshot_id: data.snapshot_id || null };
+  }
+  if (error && !MISSING_RPC_CODES.includes(error.code)) {
+    console.error('reportBuilder: report_run_snapshot error', error.message);
+    return { data: emptyResult(), cached: false, snapshot_id: null };
+  }
+
+  // Sin migración 013: build + snapshot como antes
+  const result = await buildReport(supabase, report.config);
+  const snapshot = await saveSnapshot(supabase, report.id, result);
+  return { data: result, cached: false, snapshot_id: snapshot?.id || null };
+}
+
+/** ¿Le toca correr hoy? daily siempre, weekly los lunes, monthly el día 1 */
+export function isReportDue(schedule: ReportSchedule | null | undefined, now: Date = new Date()): boolean {
+  if (!schedule || !schedule.active) return false;
+  switch (schedule.frequency) {
+    case 'daily': return true;
+    case 'weekly': return now.getUTCDay() === 1;
+    case 'monthly': return now.getUTCDate() === 1;
+    default: return false;
+  }
+}
+
+/** Cron: materializa los reportes programados del tenant (una llamada a la base por reporte) */
+export async function runScheduledReports(supabase: SupabaseService, now: Date = new Date()): Promise<{ ran: number; cached: number; failed: number }> {
+  const { data: reports, error } = await supabase.client
+    .from('saved_reports').select('*')
+    .eq('tenant_id', supabase.getTenantId())
+    .not('schedule', 'is', null);
+  if (error) { console.error('reportBuilder: runScheduledReports error', error.message); return { ran: 0, cached: 0, failed: 0 }; }
+
+  const stats = { ran: 0, cached: 0, failed: 0 };
+  for (const report of (reports || []) as SavedReport[]) {
+    if (!isReportDue(report.schedule, now)) continue;
+    try {
+      const run = await runSavedReport(supabase, report);
+      stats.ran++;
+      if (run.cached) stats.cached++;
+    } catch (e) {
+      stats.failed++;
+      console.error(`reportBuilder: reporte programado ${report.id} falló`, e);
+    }
+  }
+  return stats;
+}
+
 // --- CSV EXPORT ---
 
+function csvEscape(val: any): string {
+  const s = val === null || val === undefined ? '' : String(val);
+  return s.includes(',') || s.includes('"') || s.includes('\n') ? `"${s.replace(/"/g, '""')}"` : s;
+}
+
 export function exportReportToCSV(result: ReportResult): string {
   if (result.rows.length === 0) return '';
   const headers = Object.keys(result.rows[0]);
-  const esc = (val: any): string => {
-    const s = val === null || val === undefined ? '' : String(val);
-    return s.includes(',') || s.includes('"') || s.includes('\n') ? `"${s.replace(/"/g, '""')}"` : s;
-  };
-  const lines: string[] = [headers.map(esc).join(',')];
-  for (const row of result.rows) lines.push(headers.map(h => esc(row[h])).join(','));
+  const lines: string[] = [headers.map(csvEscape).join(',')];
+  for (const row of result.rows) lines.push(headers.map(h => csvEscape(row[h])).join(','));
   return lines.join('\n');
 }
+
+// --- STREAMING ---
+
+/**
+ * Filas del reporte en páginas de report_aggregate (offset sobre el GROUP BY
+ * ordenado): reportes con miles de grupos no se arman completos en memoria.
+ * Sin la migración 013 se emiten las filas de buildReport.
+ */
+export function streamReportRows(supabase: SupabaseService, config: ReportConfig, pageSize: number = REPORT_PAGE_SIZE): ReadableStream<Record<string, any>> {
+  const plan = planReport(config);
+  const cap = plan.limit || Infinity;
+  let offset = 0;
+  return new ReadableStream<Record<string, any>>({
+    start(controller) {
+      const invalid = validateReportConfig(config);
+      if (invalid) controller.error(new Error(invalid));
+    },
+    async pull(controller) {
+      const limit = Math.min(pageSize, cap - offset);
+      let page: { rows: Record<string, any>[] } | null;
+      try {
+        page = await runAggregate(supabase, { ...plan, limit, offset, totals: false });
+      } catch (e) {
+        controller.error(e);
+        return;
+      }
+      if (!page) {
+        const result = await buildReportInWorker(supabase, config);
+        for (const row of result.rows) controller.enqueue(row);
+        controller.close();
+        return;
+      }
+      for (const row of page.rows) controller.enqueue(row);
+      offset += page.rows.length;
+      if (page.rows.length < limit || offset >= cap) controller.close();
+    }
+  }, { highWaterMark: 0 });
+}
+
+/** CSV en streaming; el encabezado sale del plan (dimensiones + métricas) */
+export function streamReportCSV(supabase: SupabaseService, config: ReportConfig, pageSize: number = REPORT_PAGE_SIZE): ReadableStream<Uint8Array> {
+  const headers = planColumns(planReport(config));
+  const encoder = new TextEncoder();
+  return streamReportRows(supabase, config, pageSize).pipeThrough(new TransformStream<Record<string, any>, Uint8Array>({
+    start(controller) {
+      controller.enqueue(encoder.encode(headers.map(csvEscape).join(',')));
+    },
+    transform(row, controller) {
+      controller.enqueue(encoder.encode('\n' + headers.map(h => csvEscape(row[h])).join(',')));
+    }
+  }));
+}
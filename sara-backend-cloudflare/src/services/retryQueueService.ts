@@ -1,5 +1,5 @@
 import { SupabaseService } from './supabase';
-import { MetaWhatsAppService } from './meta-whatsapp';
+import { MetaWhatsAppService, SendManyJob } from './meta-whatsapp';
 import { isRetryableError } from './retryService';
 
 export interface RetryQueueEntry {
@@ -12,6 +12,44 @@ export interface RetryQueueEntry {
   max_attempts: number;
   last_error: string | null;
   status: string;
+  next_retry_at?: string | null;
+  locked_until?: string | null;
+  locked_by?: string | null;
+}
+
+// ═══════════════════════════════════════════════════════════════════════════
+// SCHEDULING (requiere migrations/008_retry_queue_scheduler.sql)
+// ═══════════════════════════════════════════════════════════════════════════
+
+export const RETRY_CLAIM_BATCH = 50;            // Filas por claim
+export const RETRY_LEASE_SECONDS = 180;         // < intervalo del CRON (4 min)
+export const RETRY_CONCURRENCY = 4;             // Destinatarios en paralelo (bajo el rate limit global)
+export const RETRY_BASE_DELAY_MS = 2 * 60 * 1000;
+export const RETRY_MAX_DELAY_MS = 60 * 60 * 1000;
+export const RETRY_RATE_LIMITED_DELAY_MS = 60 * 1000; // Rate limit global = ventana de 1 min
+
+interface RetryCompletion {
+  id: string;
+  status: 'pending' | 'delivered' | 'failed_permanent';
+  attempts: number;
+  last_error?: string | null;
+  next_retry_at?: string | null;
+}
+
+/**
+ * Next attempt time after `attempts` failed retries: exponential backoff
+ * (2m, 4m, 8m... capped at 1h) with equal jitter, so messages that failed in
+ * the same outage do not all come back in the same minute.
+ */
+export function computeNextRetryAt(
+  attempts: number,
+  now: number = Date.now(),
+  random: () => number = Math.random,
+  baseDelayMs: number = RETRY_BASE_DELAY_MS
+): string {
+  const exp = Math.min(RETRY_MAX_DELAY_MS, baseDelayMs * Math.pow(2, Math.max(0, attempts - 1)));
+  const delay = exp / 2 + random() * (exp / 2);
+  return new Date(now + delay).toISOString();
 }
 
 /**
@@ -58,15 +96,245 @@ export async function enqueueFailedMessage(
 }
 
 /**
- * Process pending items in retry_queue.
+ * Batch version of enqueueFailedMessage: one multi-row insert for all
+ * retryable failures (used by MetaWhatsAppService.sendMany).
+ * Must never throw — wrapped in try-catch.
+ */
+export async function enqueueFailedMessages(
+  supabase: SupabaseService,
+  items: Array<{
+    recipientPhone: string;
+    messageType: string;
+    payload: Record<string, any>;
+    context: string;
+    errorMessage: string;
+  }>
+): Promise<void> {
+  try {
+    const rows = items
+      .filter(item => {
+        const syntheticError: any = new Error(item.errorMessage);
+        const statusMatch = item.errorMessage.match(/(\d{3})/);
+        if (statusMatch) {
+          syntheticError.status = parseInt(statusMatch[1]);
+        }
+        return isRetryableError(syntheticError);
+      })
+      .map(item => ({
+        recipient_phone: item.recipientPhone,
+        message_type: item.messageType,
+        payload: item.payload,
+        context: item.context?.substring(0, 200),
+        last_error: item.errorMessage?.substring(0, 500),
+        status: 'pending',
+        attempts: 0,
+        max_attempts: 3
+      }));
+
+    if (rows.length < items.length) {
+      console.log(`⏭️ Retry queue: skipping ${items.length - rows.length} non-retryable errors`);
+    }
+    if (rows.length === 0) return;
+
+    const { error: insertErr } = await supabase.client.from('retry_queue').insert(rows);
+    if (insertErr) console.error('⚠️ Retry queue batch insert error:', insertErr.message);
+    else console.log(`📥 Retry queue: enqueued ${rows.length} messages`);
+  } catch (err) {
+    console.error('❌ Retry queue batch enqueue failed (silent):', (err as Error).message);
+  }
+}
+
+export interface RetryQueueRunResult {
+  processed: number;
+  delivered: number;
+  failedPermanent: number;
+  rescheduled: number; // Frenados por el rate limit global: vuelven en ~1 min sin gastar intento
+}
+
+/**
+ * Process due items in retry_queue.
  * Called from CRON every ~4 minutes.
+ *
+ * 1. Claim up to RETRY_CLAIM_BATCH rows whose next_retry_at has passed, with a
+ *    lease (claim_retry_queue, FOR UPDATE SKIP LOCKED) so overlapping runs never
+ *    double-send.
+ * 2. Redeliver through meta.sendMany: concurrent per recipient, still under
+ *    the global Meta rate limit, without re-enqueueing failures (requeue: false).
+ * 3. Write every outcome in one statement (complete_retry_queue).
  */
 export async function processRetryQueue(
   supabase: SupabaseService,
   meta: MetaWhatsAppService,
   devPhone: string
-): Promise<{ processed: number; delivered: number; failedPermanent: number }> {
-  const result = { processed: 0, delivered: 0, failedPermanent: 0 };
+): Promise<RetryQueueRunResult> {
+  const result: RetryQueueRunResult = { processed: 0, delivered: 0, failedPermanent: 0, rescheduled: 0 };
+  const workerId = crypto.randomUUID();
+
+  const claimed = await claimRetryEntries(supabase, workerId);
+  if (claimed === null) {
+    return processRetryQueueLegacy(supabase, meta, devPhone);
+  }
+  if (claimed.length === 0) return result;
+
+  const completions: RetryCompletion[] = [];
+  const sendable: RetryQueueEntry[] = [];
+  const jobs: SendManyJob[] = [];
+
+  for (const entry of claimed) {
+    const job = buildRetryJob(entry);
+    if (!job) {
+      console.warn(`⚠️ Retry queue: unsupported message_type "${entry.message_type}" — marking as failed`);
+      completions.push({
+        id: entry.id,
+        status: 'failed_permanent',
+        attempts: entry.attempts || 0,
+        last_error: `Unsupported message_type: ${entry.message_type}`
+      });
+      result.processed++;
+      result.failedPermanent++;
+      continue;
+    }
+    sendable.push(entry);
+    jobs.push(job);
+  }
+
+  const outcomes = jobs.length > 0
+    ? await meta.sendMany(jobs, { concurrency: RETRY_CONCURRENCY, requeue: false })
+    : [];
+
+  const permanentFailures: Array<{ entry: RetryQueueEntry; error: string; attempts: number }> = [];
+  const now = Date.now();
+
+  outcomes.forEach((outcome, i) => {
+    const entry = sendable[i];
+    result.processed++;
+
+    // Rate limit global: no fue un fallo de Meta, reprogramar sin gastar intento
+    if (outcome.ok && outcome.result?.rate_limited) {
+      completions.push({
+        id: entry.id,
+        status: 'pending',
+        attempts: entry.attempts || 0,
+        next_retry_at: computeNextRetryAt(1, now, Math.random, RETRY_RATE_LIMITED_DELAY_MS)
+      });
+      result.rescheduled++;
+      return;
+    }
+
+    const newAttempts = (entry.attempts || 0) + 1;
+    if (outcome.ok) {
+      completions.push({ id: entry.id, status: 'delivered', attempts: newAttempts });
+      result.delivered++;
+      console.log(`✅ Retry queue: delivered ${entry.message_type} to ${entry.recipient_phone} (attempt ${newAttempts})`);
+      return;
+    }
+
+    const errMsg = (outcome.error || 'Unknown error').substring(0, 500);
+    if (newAttempts >= entry.max_attempts) {
+      completions.push({ id: entry.id, status: 'failed_permanent', attempts: newAttempts, last_error: errMsg });
+      permanentFailures.push({ entry, error: errMsg, attempts: newAttempts });
+      result.failedPermanent++;
+      console.error(`❌ Retry queue: permanent failure for ${entry.recipient_phone} after ${newAttempts} attempts`);
+    } else {
+      completions.push({
+        id: entry.id,
+        status: 'pending',
+        attempts: newAttempts,
+        last_error: errMsg,
+        next_retry_at: computeNextRetryAt(newAttempts, now)
+      });
+      console.log(`🔄 Retry queue: ${entry.recipient_phone} retry #${newAttempts}`);
+    }
+  });
+
+  await completeRetryEntries(supabase, workerId, completions);
+
+  // Alert dev (un solo mensaje por corrida)
+  if (permanentFailures.length > 0) {
+    try {
+      const detalle = permanentFailures.slice(0, 5).map(f =>
+        `📱 Destino: ${f.entry.recipient_phone}\n` +
+        `📝 Tipo: ${f.entry.message_type}\n` +
+        `❌ Error: ${f.error.substring(0, 200)}\n` +
+        `🔄 Intentos: ${f.attempts}/${f.entry.max_attempts}`
+      ).join('\n\n');
+      const extra = permanentFailures.length > 5 ? `\n\n…y ${permanentFailures.length - 5} más` : '';
+      await meta.sendWhatsAppMessage(devPhone,
+        `🚨 RETRY QUEUE: ${permanentFailures.length === 1 ? 'Mensaje falló' : `${permanentFailures.length} mensajes fallaron`} permanentemente\n\n` +
+        detalle + extra
+      );
+    } catch (alertErr) { console.error('Error sending permanent failure alert:', alertErr); }
+  }
+
+  if (result.processed > 0) {
+    console.log(`📬 Retry queue: ${result.delivered} delivered, ${result.failedPermanent} failed, ${result.rescheduled} rescheduled of ${result.processed} processed`);
+  }
+
+  return result;
+}
+
+/**
+ * Claim due rows with a lease. Returns null when the scheduler RPC is not
+ * deployed yet (caller falls back to the legacy path).
+ */
+async function claimRetryEntries(supabase: SupabaseService, workerId: string): Promise<RetryQueueEntry[] | null> {
+  const { data, error } = await supabase.client.rpc('claim_retry_queue', {
+    p_worker: workerId,
+    p_limit: RETRY_CLAIM_BATCH,
+    p_lease_seconds: RETRY_LEASE_SECONDS
+  });
+  if (error) {
+    // PGRST202 / 42883 = función no existe (migración 008 sin aplicar)
+    if (error.code === 'PGRST202' || error.code === '42883') {
+      console.warn('⚠️ Retry queue: claim_retry_queue no existe, usando modo legacy');
+      return null;
+    }
+    console.error('⚠️ Retry queue claim error:', error.message);
+    return [];
+  }
+  return (data || []) as RetryQueueEntry[];
+}
+
+/** Apply all outcomes in a single UPDATE ... FROM jsonb_to_recordset */
+async function completeRetryEntries(supabase: SupabaseService, workerId: string, completions: RetryCompletion[]): Promise<void> {
+  if (completions.length === 0) return;
+  const { error } = await supabase.client.rpc('complete_retry_queue', {
+    p_worker: workerId,
+    p_results: completions
+  });
+  // Si falla, el lease vence y las filas se reintentan en la siguiente corrida
+  if (error) console.error('⚠️ Retry queue complete error:', error.message);
+}
+
+function buildRetryJob(entry: RetryQueueEntry): SendManyJob | null {
+  const payload = entry.payload || {};
+  switch (entry.message_type) {
+    case 'text':
+      return { to: entry.recipient_phone, text: payload.body, bypassRateLimit: true };
+    case 'template':
+      return {
+        to: entry.recipient_phone,
+        template: { name: payload.templateName, languageCode: payload.languageCode || 'es_MX', components: payload.components },
+        bypassRateLimit: true
+      };
+    case 'image':
+      // enqueue desde sendWhatsAppImage guarda { url }, entradas manuales { imageUrl }
+      return { to: entry.recipient_phone, image: { url: payload.imageUrl || payload.url, caption: payload.caption } };
+    default:
+      return null;
+  }
+}
+
+/**
+ * Pre-migration path: serial retry of 10 rows per run, one UPDATE per row.
+ * Only used while claim_retry_queue is not deployed.
+ */
+async function processRetryQueueLegacy(
+  supabase: SupabaseService,
+  meta: MetaWhatsAppService,
+  devPhone: string
+): Promise<RetryQueueRunResult> {
+  const result: RetryQueueRunResult = { processed: 0, delivered: 0, failedPermanent: 0, rescheduled: 0 };
 
   const { data: pending, error } = await supabase.client
     .from('retry_queue')
@@ -100,7 +368,7 @@ export async function processRetryQueue(
           );
           break;
         case 'image':
-          await meta.sendWhatsAppImage(entry.recipient_phone, entry.payload.imageUrl, entry.payload.caption);
+          await meta.sendWhatsAppImage(entry.recipient_phone, entry.payload.imageUrl || entry.payload.url, entry.payload.caption);
           break;
         default:
           console.warn(`⚠️ Retry queue: unsupported message_type "${entry.message_type}" — marking as failed`);
@@ -130,6 +130,23 @@ function periodLabel(period: 'month' | 'quarter' | 'year'): string {
   }
 }
 
+function toAttribution(
+  channel: string,
+  data: { campaign?: string; leads: number; closed: number; revenue: number; spend: number; avgDaysToClose: number }
+): Attribution {
+  return {
+    channel,
+    campaign: data.campaign,
+    leads: data.leads,
+    closed: data.closed,
+    revenue: data.revenue,
+    roas: data.spend > 0 ? Math.round((data.revenue / data.spend) * 10) / 10 : -1,
+    costPerLead: data.spend > 0 ? Math.round(data.spend / data.leads) : 0,
+    costPerSale: data.spend > 0 && data.closed > 0 ? Math.round(data.spend / data.closed) : 0,
+    avgDaysToClose: Math.round(data.avgDaysToClose * 10) / 10,
+  };
+}
+
 function formatMoney(amount: number): string {
   if (amount >= 1_000_000) {
     return `$${(amount / 1_000_000).toFixed(1)}M`;
@@ -181,10 +198,35 @@ export class RevenueAttributionService {
 
   // ─────────────────────────────────────────────────────────────────────
   // Get attribution report for a period
+  // Suma los acumuladores por lead (lead_value_stats, migración 015) en
+  // una llamada; sin la migración re-escanea leads + notes.
   // ─────────────────────────────────────────────────────────────────────
   async getAttributionReport(period: 'month' | 'quarter' | 'year'): Promise<Attribution[]> {
     const startDate = periodStartDate(period);
 
+    const { data: rows, error } = await this.supabase.client
+      .rpc('revenue_attribution_summary', { p_since: startDate.toISOString() });
+
+    if (!error && Array.isArray(rows)) {
+      return rows
+        .map((r: any) => toAttribution(r.channel, {
+          campaign: r.campaigns || undefined,
+          leads: Number(r.leads) || 0,
+          closed: Number(r.closed) || 0,
+          revenue: Number(r.revenue) || 0,
+          spend: Number(r.spend) || 0,
+          avgDaysToClose: Number(r.avg_days_to_close) || 0,
+        }))
+        .sort((a: Attribution, b: Attribution) => b.revenue - a.revenue);
+    }
+
+    if (error && error.code !== 'PGRST202' && error.code !== '42883') {
+      console.error('⚠️ RevenueAttribution summary error:', error.message);
+    }
+    return this.getAttributionReportFromLeads(startDate);
+  }
+
+  private async getAttributionReportFromLeads(startDate: Date): Promise<Attribution[]> {
     // Fetch all leads in period
     const { data: leads, error } = await this.supabase.client
       .from('leads')
@@ -247,23 +289,16 @@ export class RevenueAttributionService {
 
     // Build attribution array
     const attributions: Attribution[] = Object.entries(channelData)
-      .map(([channel, data]) => {
-        const avgClose = data.closeDays.length > 0
-          ? Math.round((data.closeDays.reduce((a, b) => a + b, 0) / data.closeDays.length) * 10) / 10
-          : 0;
-
-        return {
-          channel,
-          campaign: data.campaigns.size > 0 ? [...data.campaigns].join(', ') : undefined,
-          leads: data.leads,
-          closed: data.closed,
-          revenue: data.revenue,
-          roas: data.spend > 0 ? Math.round((data.revenue / data.spend) * 10) / 10 : -1,
-          costPerLead: data.spend > 0 ? Math.round(data.spend / data.leads) : 0,
-          costPerSale: data.spend > 0 && data.closed > 0 ? Math.round(data.spend / data.closed) : 0,
-          avgDaysToClose: avgClose,
-        };
-      })
+      .map(([channel, data]) => toAttribution(channel, {
+        campaign: data.campaigns.size > 0 ? [...data.campaigns].join(', ') : undefined,
+        leads: data.leads,
+        closed: data.closed,
+        revenue: data.revenue,
+        spend: data.spend,
+        avgDaysToClose: data.closeDays.length > 0
+          ? data.closeDays.reduce((a, b) => a + b, 0) / data.closeDays.length
+          : 0,
+      }))
       .sort((a, b) => b.revenue - a.revenue); // Sort by revenue descending
 
     return attributions;
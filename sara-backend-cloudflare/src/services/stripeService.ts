@@ -1,5 +1,6 @@
 // STRIPE SERVICE - Billing via Stripe API (fetch-based, no SDK)
 import { SupabaseService } from './supabase';
+import { invalidateTenant } from '../middleware/tenant';
 
 export interface CheckoutParams {
   customer_email?: string;
@@ -109,6 +110,7 @@ export async function handleWebhookEvent(supabase: SupabaseService, event: Strip
         await supabase.client.from('tenants').update({
           stripe_customer_id: obj.customer, stripe_subscription_id: obj.subscription, active: true,
         }).eq('id', tenantId);
+        invalidateTenant(tenantId);
       }
       await logBillingEvent(supabase, {
         event_type: 'checkout.completed', stripe_event_id: event.id,
@@ -141,6 +143,7 @@ export async function handleWebhookEvent(supabase: SupabaseService, event: Strip
         await supabase.client.from('tenants').update({
           active: false, plan: 'free', suspended_at: new Date().toISOString(), stripe_subscription_id: null,
         }).eq('id', tenant.id);
+        invalidateTenant(tenant.id);
       }
       await logBillingEvent(supabase, {
         event_type: 'subscription.cancelled', stripe_event_id: event.id,
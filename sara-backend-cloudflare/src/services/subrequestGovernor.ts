@@ -0,0 +1,224 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// SUBREQUEST GOVERNOR - Presupuesto de subrequests por invocación
+// Cloudflare (plan Standard) corta la invocación al llegar a 1,000 subrequests.
+// Cuenta cada fetch (Meta, Supabase, OpenAI, Retell...), operación KV y R2,
+// asigna presupuesto por tarea CRON y difiere tareas de baja prioridad
+// cuando el presupuesto global se está agotando.
+// ═══════════════════════════════════════════════════════════════════════════
+
+// ═══════════════════════════════════════════════════════════════════════════
+// TYPES
+// ═══════════════════════════════════════════════════════════════════════════
+
+export type SubrequestKind = 'fetch' | 'kv' | 'r2';
+
+export type CronTaskPriority = 'critical' | 'normal' | 'low';
+
+export interface CronTaskBudgetOptions {
+  priority?: CronTaskPriority;
+  budget?: number; // Máximo de subrequests que la tarea debería consumir
+}
+
+export interface TaskConsumption {
+  name: string;
+  priority: CronTaskPriority;
+  budget?: number;
+  used: number;
+  byKind: Record<SubrequestKind, number>;
+  overBudget: boolean;
+}
+
+export interface GovernorSummary {
+  limit: number;
+  used: number;
+  remaining: number;
+  byKind: Record<SubrequestKind, number>;
+  tasks: TaskConsumption[];
+  deferred: string[];
+}
+
+// Límite de Cloudflare Workers Standard (ver wrangler.toml)
+export const SUBREQUEST_LIMIT = 1000;
+// Reserva para persistir tracker, loguear errores y alertar al final del CRON
+export const SUBREQUEST_RESERVE = 50;
+// Debajo de este remanente, las tareas 'low' se difieren al siguiente tick
+export const LOW_PRIORITY_FLOOR = 200;
+
+// ═══════════════════════════════════════════════════════════════════════════
+// GOVERNOR
+// ═══════════════════════════════════════════════════════════════════════════
+
+// Parche de fetch compartido por el isolate (ver install)
+const installedGovernors = new Set<SubrequestGovernor>();
+let originalFetch: typeof fetch | null = null;
+
+export class SubrequestGovernor {
+  private used = 0;
+  private byKind: Record<SubrequestKind, number> = { fetch: 0, kv: 0, r2: 0 };
+  private tasks: TaskConsumption[] = [];
+  private currentTask: TaskConsumption | null = null;
+  private deferred: string[] = [];
+
+  constructor(
+    private limit: number = SUBREQUEST_LIMIT,
+    private reserve: number = SUBREQUEST_RESERVE,
+    private lowPriorityFloor: number = LOW_PRIORITY_FLOOR
+  ) {}
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // CONTEO
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  record(kind: SubrequestKind, count: number = 1): void {
+    this.used += count;
+    this.byKind[kind] += count;
+    if (this.currentTask) {
+      this.currentTask.used += count;
+      this.currentTask.byKind[kind] += count;
+      if (this.currentTask.budget !== undefined && this.currentTask.used > this.currentTask.budget && !this.currentTask.overBudget) {
+        this.currentTask.overBudget = true;
+        console.warn(`⚠️ SUBREQUESTS: ${this.currentTask.name} excedió su presupuesto (${this.currentTask.budget})`);
+      }
+    }
+  }
+
+  getUsed(): number {
+    return this.used;
+  }
+
+  /** Subrequests disponibles para trabajo normal (descontando la reserva final) */
+  getRemaining(): number {
+    return Math.max(0, this.limit - this.reserve - this.used);
+  }
+
+  /**
+   * ¿Puedo gastar N subrequests más?
+   * Considera el presupuesto global y, si hay tarea activa con presupuesto, el de la tarea.
+   */
+  canAfford(n: number): boolean {
+    if (n > this.getRemaining()) return false;
+    const task = this.currentTask;
+    if (task && task.budget !== undefined && task.used + n > task.budget) return false;
+    return true;
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // TAREAS
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  /**
+   * Decide si una tarea debe correr en este tick.
+   * Las tareas 'low' se difieren cuando el remanente cae bajo LOW_PRIORITY_FLOOR
+   * o no alcanza su presupuesto declarado; las 'normal' con presupuesto, cuando
+   * el remanente no lo alcanza. Las 'critical' siempre corren. Solo declarar
+   * presupuesto en tareas que se re-evalúan cada tick (*\/2), así diferir =
+   * correr en el siguiente tick.
+   */
+  shouldRun(name: string, options: CronTaskBudgetOptions = {}): boolean {
+    const priority = options.priority || 'normal';
+    if (priority === 'critical') return true;
+    if (priority === 'normal' && options.budget === undefined) return true;
+
+    const remaining = this.getRemaining();
+    const needed = priority === 'low'
+      ? Math.max(this.lowPriorityFloor, options.budget || 0)
+      : options.budget!;
+    if (remaining < needed) {
+      this.deferred.push(name);
+      console.warn(`⏭️ SUBREQUESTS: ${name} diferida al siguiente tick (${remaining} restantes, requiere ${needed})`);
+      return false;
+    }
+    return true;
+  }
+
+  beginTask(name: string, options: CronTaskBudgetOptions = {}): TaskConsumption {
+    const task: TaskConsumption = {
+      name,
+      priority: options.priority || 'normal',
+      budget: options.budget,
+      used: 0,
+      byKind: { fetch: 0, kv: 0, r2: 0 },
+      overBudget: false
+    };
+    this.tasks.push(task);
+    this.currentTask = task;
+    return task;
+  }
+
+  endTask(): void {
+    this.currentTask = null;
+  }
+
+  isDeferred(name: string): boolean {
+    return this.deferred.includes(name);
+  }
+
+  getSummary(): GovernorSummary {
+    return {
+      limit: this.limit,
+      used: this.used,
+      remaining: this.getRemaining(),
+      byKind: { ...this.byKind },
+      tasks: this.tasks.map(t => ({ ...t, byKind: { ...t.byKind } })),
+      deferred: [...this.deferred]
+    };
+  }
+
+  // ═══════════════════════════════════════════════════════════════════════════
+  // INSTRUMENTACIÓN
+  // ═══════════════════════════════════════════════════════════════════════════
+
+  /**
+   * Cuenta cada fetch del isolate mientras el governor esté instalado.
+   * Debe llamarse ANTES de crear SupabaseService (supabase-js captura fetch al crearse).
+   * globalThis.fetch se parchea una sola vez por isolate y se comparte entre
+   * invocaciones CRON que se traslapan: cada governor instalado cuenta los
+   * fetch del isolate (conservador, nunca subestima) y el fetch original se
+   * restaura cuando se desinstala el último.
+   */
+  install(): void {
+    if (installedGovernors.has(this)) return;
+    installedGovernors.add(this);
+    if (!originalFetch) {
+      const original = globalThis.fetch;
+      originalFetch = original;
+      globalThis.fetch = function countedFetch(input: any, init?: any) {
+        for (const governor of installedGovernors) governor.record('fetch');
+        return original(input, init);
+      } as typeof fetch;
+    }
+  }
+
+  /** Deja de contar; el último en desinstalarse restaura el fetch original. Llamar en finally. */
+  uninstall(): void {
+    if (!installedGovernors.delete(this)) return;
+    if (installedGovernors.size === 0 && originalFetch) {
+      globalThis.fetch = originalFetch;
+      originalFetch = null;
+    }
+  }
+
+  /** Envuelve un binding (KV / R2) para contar cada llamada a método como subrequest */
+  wrapBinding<T extends object>(binding: T, kind: SubrequestKind): T {
+    const governor = this;
+    return new Proxy(binding, {
+      get(target, prop, receiver) {
+        const value = Reflect.get(target, prop, receiver);
+        if (typeof value !== 'function') return value;
+        return function (this: any, ...args: any[]) {
+          governor.record(kind);
+          return value.apply(target, args);
+        };
+      }
+    });
+  }
+
+  /** Devuelve una copia de env con SARA_CACHE y SARA_BACKUPS instrumentados */
+  wrapEnv<E extends { SARA_CACHE?: KVNamespace; SARA_BACKUPS?: R2Bucket }>(env: E): E {
+    return {
+      ...env,
+      SARA_CACHE: env.SARA_CACHE ? this.wrapBinding(env.SARA_CACHE, 'kv') : env.SARA_CACHE,
+      SARA_BACKUPS: env.SARA_BACKUPS ? this.wrapBinding(env.SARA_BACKUPS, 'r2') : env.SARA_BACKUPS
+    };
+  }
+}
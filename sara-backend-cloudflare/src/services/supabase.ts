@@ -1,33 +1,128 @@
 import { createClient } from '@supabase/supabase-js';
 import { SANTA_RITA_TENANT_ID } from '../middleware/tenant';
+import { signClaims } from '../middleware/auth';
 import { incrementMetric, checkPlanLimit } from './usageTrackingService';
+import { getEntityCache } from './entityCache';
+
+// ═══ Clientes supabase-js por tenant (isolate) ═══
+// Cada cliente manda un JWT firmado por el worker (role anon + claim
+// tenant_id) en todas las requests; current_tenant_id() solo confía en ese
+// claim (migración 018), que PostgREST verifica con el JWT secret. Un header
+// X-Tenant-ID lo podría mandar cualquiera que tenga la anon key.
+export const SUPABASE_CLIENT_POOL_MAX = 50;
+const clientPool = new Map<string, any>();
+
+// ═══ JWT de tenant (SUPABASE_JWT_SECRET) ═══
+const TENANT_JWT_TTL_SECONDS = 60 * 60;
+const TENANT_JWT_RENEW_SECONDS = 5 * 60;
+let tenantJwtSecret: string | undefined;
+let warnedNoSecret = false;
+const tenantTokens = new Map<string, { token: Promise<string>; exp: number }>();
+
+/** Lo llaman fetch/queue/scheduled con env.SUPABASE_JWT_SECRET */
+export function setTenantJwtSecret(secret?: string): void {
+  if (secret === tenantJwtSecret) return;
+  tenantJwtSecret = secret;
+  tenantTokens.clear();
+}
+
+/**
+ * Token del tenant (cacheado hasta 5 min antes de expirar). Sin secret
+ * devuelve null: las queries usan la anon key y caen en el tenant default.
+ */
+export function getTenantToken(tenantId: string, nowMs: number = Date.now()): Promise<string> | null {
+  if (!tenantJwtSecret) {
+    if (!warnedNoSecret) {
+      warnedNoSecret = true;
+      console.warn('⚠️ SUPABASE_JWT_SECRET no configurado: queries sin tenant firmado (default Santa Rita)');
+    }
+    return null;
+  }
+  const now = Math.floor(nowMs / 1000);
+  const cached = tenantTokens.get(tenantId);
+  if (cached && cached.exp - TENANT_JWT_RENEW_SECONDS > now) return cached.token;
+
+  const token = signClaims({ role: 'anon', tenant_id: tenantId }, tenantJwtSecret, TENANT_JWT_TTL_SECONDS, now);
+  const entry = { token, exp: now + TENANT_JWT_TTL_SECONDS };
+  tenantTokens.set(tenantId, entry);
+  token.catch(() => {
+    if (tenantTokens.get(tenantId) === entry) tenantTokens.delete(tenantId);
+  });
+  while (tenantTokens.size > SUPABASE_CLIENT_POOL_MAX) {
+    const oldest = tenantTokens.keys().next().value;
+    if (oldest === undefined) break;
+    tenantTokens.delete(oldest);
+  }
+  return token;
+}
+
+export function getTenantClient(url: string, key: string, tenantId: string): any {
+  const poolKey = `${url}|${key}|${tenantId}`;
+  let client = clientPool.get(poolKey);
+  if (client) {
+    // LRU: re-insertar al final
+    clientPool.delete(poolKey);
+  } else {
+    client = createClient(url, key, {
+      global: {
+        // fetch resuelto en cada llamada: un cliente del pool creado antes de
+        // instalar el SubrequestGovernor del CRON igual usa el fetch contado
+        fetch: async (input: any, init?: any) => {
+          const token = getTenantToken(tenantId);
+          if (!token) return fetch(input, init);
+          const headers = new Headers(init?.headers);
+          headers.set('Authorization', `Bearer ${await token}`);
+          return fetch(input, { ...init, headers });
+        }
+      }
+    });
+  }
+  clientPool.set(poolKey, client);
+  while (clientPool.size > SUPABASE_CLIENT_POOL_MAX) {
+    const oldest = clientPool.keys().next().value;
+    if (oldest === undefined) break;
+    clientPool.delete(oldest);
+  }
+  return client;
+}
+
+/**
+ * Fachada estable sobre el cliente del tenant actual: cada acceso resuelve
+ * el cliente en ese momento, así quien guardó `supabase.client` (servicios
+ * que lo reciben en el constructor) sigue al tenant después de setTenant().
+ */
+function routedClient(resolve: () => any): any {
+  return new Proxy({}, {
+    get(_target, prop) {
+      const client = resolve();
+      const value = client[prop];
+      return typeof value === 'function' ? value.bind(client) : value;
+    }
+  });
+}
+
+export function getClientPoolSize(): number {
+  return clientPool.size;
+}
 
 export class SupabaseService {
   public client: any;
   private tenantId: string;
-  private tenantSet: boolean = false;
 
-  constructor(url: string, key: string, tenantId?: string) {
-    this.client = createClient(url, key);
+  constructor(private url: string, private key: string, tenantId?: string) {
     this.tenantId = tenantId || SANTA_RITA_TENANT_ID;
+    this.client = routedClient(() => getTenantClient(this.url, this.key, this.tenantId));
   }
 
   /**
-   * Set the tenant context via Postgres session variable.
-   * Must be called once per request before any queries.
-   * RLS policies use current_setting('app.current_tenant') to filter rows.
+   * Set the tenant context for the rest of this request / CRON iteration.
+   * `client` routes every query to the pooled client of that tenant (signed
+   * tenant_id claim), so RLS policies resolve current_tenant_id() without a
+   * set_tenant RPC, including through references taken before the switch.
    */
   async setTenant(tenantId?: string): Promise<void> {
-    if (tenantId) {
-      this.tenantId = tenantId;
-    }
-    try {
-      await this.client.rpc('set_tenant', { tid: this.tenantId });
-      this.tenantSet = true;
-    } catch (err: any) {
-      console.error('❌ set_tenant RPC failed:', err?.message);
-      this.tenantSet = false;
-    }
+    if (!tenantId || tenantId === this.tenantId) return;
+    this.tenantId = tenantId;
   }
 
   getTenantId(): string {
@@ -82,9 +177,8 @@ export class SupabaseService {
     return data;
   }
 
+  /** Memoizado en el EntityCache del request/CRON */
   async getTeamMemberByPhone(phone: string) {
-    const { data, error } = await this.client.from('team_members').select('*').eq('phone', phone).single();
-    if (error && error.code !== 'PGRST116') console.error('⚠️ getTeamMemberByPhone error:', error.message);
-    return data;
+    return getEntityCache(this).getTeamMemberByPhone(phone);
   }
 }
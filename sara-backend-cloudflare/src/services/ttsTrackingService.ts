@@ -114,6 +114,56 @@ export class TTSTrackingService {
     }
   }
 
+  /**
+   * Actualiza en bloque los estados de un batch del webhook: un update por
+   * estado (delivered/read/failed) en vez de uno por mensaje
+   */
+  async updateTTSStatuses(rows: { message_id: string; status: string; error_message?: string | null }[]): Promise<number> {
+    let updated = 0;
+    for (const status of ['delivered', 'read', 'failed'] as const) {
+      const group = rows.filter(r => r.status === status);
+      if (group.length === 0) continue;
+      try {
+        const now = new Date().toISOString();
+        const updateData: any = { status, updated_at: now };
+        if (status === 'delivered') updateData.delivered_at = now;
+        else if (status === 'read') updateData.played_at = now;
+        else updateData.failed_at = now;
+
+        // failed lleva el error_message de cada fila (son pocos) → update individual
+        if (status === 'failed') {
+          for (const row of group) {
+            const { data } = await this.supabase.client
+              .from('tts_messages')
+              .update({ ...updateData, error_message: row.error_message })
+              .eq('message_id', row.message_id)
+              .select('message_id');
+            updated += data?.length || 0;
+          }
+          continue;
+        }
+
+        const { data, error } = await this.supabase.client
+          .from('tts_messages')
+          .update(updateData)
+          .in('message_id', group.map(r => r.message_id))
+          .select('recipient_name, tts_type');
+        if (error) {
+          if (error.code === '42P01') return updated; // Tabla no existe
+          console.error('Error updating TTS statuses:', error);
+          continue;
+        }
+        for (const row of data || []) {
+          console.log(`${status === 'read' ? '🎧' : '✓✓'} TTS ${status}: ${row.tts_type} → ${row.recipient_name}`);
+        }
+        updated += data?.length || 0;
+      } catch (e) {
+        console.error('Error en updateTTSStatuses:', e);
+      }
+    }
+    return updated;
+  }
+
   /**
    * Obtiene métricas de TTS de los últimos N días
    */
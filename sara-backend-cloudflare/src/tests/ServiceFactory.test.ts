@@ -1,4 +1,6 @@
-import { describe, it, expect } from 'vitest';
+import { describe, it, expect, beforeEach } from 'vitest';
+import { RequestServices, getServiceConstructionStats, resetServiceConstructionStats } from '../services/ServiceFactory';
+import { resetCacheService } from '../services/cacheService';
 
 // Tests del patrón ServiceFactory sin importar servicios que usan ESM
 // (Supabase usa ESM y causa problemas en el entorno de test)
@@ -83,3 +85,53 @@ describe('ServiceFactory Pattern', () => {
     expect(result3.id).toBe(3);
   });
 });
+
+describe('RequestServices (lazy)', () => {
+  const env = {
+    SUPABASE_URL: 'https://example.supabase.co',
+    SUPABASE_ANON_KEY: 'anon',
+    ANTHROPIC_API_KEY: 'sk-test',
+    META_PHONE_NUMBER_ID: '123',
+    META_ACCESS_TOKEN: 'token',
+  } as any;
+
+  beforeEach(() => {
+    resetServiceConstructionStats();
+    resetCacheService();
+  });
+
+  it('no construye servicios hasta su primer uso', () => {
+    const services = new RequestServices(env);
+    expect(services.getConstructed()).toEqual([]);
+
+    const cache = services.getCache();
+    expect(services.getCache()).toBe(cache);
+    expect(services.getConstructed()).toEqual(['cache']);
+  });
+
+  it('comparte servicios sin estado de request entre scopes del isolate', () => {
+    const a = new RequestServices(env);
+    const b = new RequestServices(env);
+    expect(a.getClaude()).toBe(b.getClaude());
+    expect(a.getCache()).toBe(b.getCache()); // tier en memoria y stats del isolate
+  });
+
+  it('getRetell devuelve null sin RETELL_API_KEY', async () => {
+    const services = new RequestServices(env);
+    expect(await services.getRetell()).toBeNull();
+  });
+
+  it('registra tiempos por servicio y por request', () => {
+    const services = new RequestServices(env);
+    services.getCache();
+    services.getMeta();
+    services.finish();
+    services.finish(); // idempotente
+
+    const stats = getServiceConstructionStats();
+    expect(stats.requests).toBe(1);
+    expect(stats.services.cache.count).toBe(1);
+    expect(stats.services.meta.count).toBe(1);
+    expect(stats.coldStart).toHaveProperty('cache');
+  });
+});
@@ -2,6 +2,7 @@ import { describe, it, expect } from 'vitest';
 import {
   createJWT,
   createRefreshToken,
+  signClaims,
   verifyJWT,
   hashPassword,
   verifyPassword,
@@ -130,6 +131,21 @@ describe('Auth System', () => {
     });
   });
 
+  // ━━━ Arbitrary claims (worker-signed Supabase token) ━━━
+  describe('signClaims', () => {
+    it('signs custom claims with iat/exp', async () => {
+      const token = await signClaims({ role: 'anon', tenant_id: 'tenant-x' }, TEST_SECRET, 3600, 1000);
+      const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+      expect(payload).toEqual({ role: 'anon', tenant_id: 'tenant-x', iat: 1000, exp: 4600 });
+    });
+
+    it('is verifiable with the same secret only', async () => {
+      const token = await signClaims({ role: 'anon', tenant_id: 'tenant-x' }, TEST_SECRET, 3600);
+      expect(await verifyJWT(token, TEST_SECRET)).not.toBeNull();
+      expect(await verifyJWT(token, 'wrong-secret')).toBeNull();
+    });
+  });
+
   // ━━━ Password Hashing ━━━
   describe('hashPassword', () => {
     it('produces a hash string', async () => {
@@ -0,0 +1,124 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  paginatedRowStream,
+  tablesRowStream,
+  createJsonlStream,
+  uploadStreamToR2,
+  streamRowsToR2,
+  JsonlCounter
+} from '../services/backupStreamService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// STREAMING JSONL BACKUP TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function pagesOf(rows: any[]) {
+  return vi.fn(async (from: number, to: number) => ({ data: rows.slice(from, to + 1), error: null }));
+}
+
+async function readAll(stream: ReadableStream<Uint8Array>): Promise<Uint8Array> {
+  const chunks: Uint8Array[] = [];
+  const reader = stream.getReader();
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    chunks.push(value);
+  }
+  const out = new Uint8Array(chunks.reduce((n, c) => n + c.byteLength, 0));
+  let offset = 0;
+  for (const c of chunks) { out.set(c, offset); offset += c.byteLength; }
+  return out;
+}
+
+function createR2() {
+  const parts: Uint8Array[] = [];
+  const upload = {
+    uploadPart: vi.fn(async (partNumber: number, value: Uint8Array) => {
+      parts.push(value.slice());
+      return { partNumber, etag: `e${partNumber}` };
+    }),
+    complete: vi.fn().mockResolvedValue({}),
+    abort: vi.fn().mockResolvedValue(undefined)
+  };
+  const r2 = {
+    put: vi.fn().mockResolvedValue({}),
+    createMultipartUpload: vi.fn().mockResolvedValue(upload)
+  };
+  return { r2: r2 as any, upload, parts };
+}
+
+describe('paginatedRowStream', () => {
+  it('should read pages until a short page', async () => {
+    const rows = Array.from({ length: 5 }, (_, i) => ({ id: i }));
+    const fetchPage = pagesOf(rows);
+    const counter: JsonlCounter = { rows: 0, bytes: 0 };
+
+    const text = new TextDecoder().decode(await readAll(createJsonlStream(paginatedRowStream(fetchPage, 2), counter)));
+
+    expect(text.trim().split('\n').map(l => JSON.parse(l).id)).toEqual([0, 1, 2, 3, 4]);
+    expect(fetchPage.mock.calls).toEqual([[0, 1], [2, 3], [4, 5]]);
+    expect(counter).toEqual({ rows: 5, bytes: text.length });
+  });
+
+  it('should fail the stream when a page read errors', async () => {
+    const fetchPage = vi.fn().mockResolvedValue({ data: null, error: { message: 'timeout' } });
+    await expect(readAll(paginatedRowStream(fetchPage))).rejects.toThrow('timeout');
+  });
+
+  it('tablesRowStream should tag every row with its table', async () => {
+    const stream = tablesRowStream([
+      { table: 'leads', fetchPage: pagesOf([{ id: 'l1' }]) },
+      { table: 'properties', fetchPage: pagesOf([{ id: 'p1' }, { id: 'p2' }]) }
+    ]);
+    const text = new TextDecoder().decode(await readAll(createJsonlStream(stream, { rows: 0, bytes: 0 })));
+
+    expect(text.trim().split('\n').map(l => JSON.parse(l).table)).toEqual(['leads', 'properties', 'properties']);
+  });
+});
+
+describe('uploadStreamToR2', () => {
+  it('should use a single put when everything fits in one part', async () => {
+    const { r2 } = createR2();
+    const result = await uploadStreamToR2(r2, 'k.jsonl', new Blob(['abc\n']).stream());
+
+    expect(r2.put).toHaveBeenCalledWith('k.jsonl', new TextEncoder().encode('abc\n'), { httpMetadata: { contentType: 'application/jsonl' } });
+    expect(r2.createMultipartUpload).not.toHaveBeenCalled();
+    expect(result).toEqual({ storedBytes: 4, parts: 1 });
+  });
+
+  it('should split large streams into fixed-size multipart parts', async () => {
+    const { r2, upload, parts } = createR2();
+    const result = await uploadStreamToR2(r2, 'k.jsonl', new Blob(['0123456789', 'abcde']).stream(), { partSize: 4 });
+
+    expect(parts.map(p => p.byteLength)).toEqual([4, 4, 4, 3]);
+    expect(new TextDecoder().decode(parts[3])).toBe('cde');
+    expect(upload.complete).toHaveBeenCalledWith(parts.map((_, i) => ({ partNumber: i + 1, etag: `e${i + 1}` })));
+    expect(r2.put).not.toHaveBeenCalled();
+    expect(result).toEqual({ storedBytes: 15, parts: 4 });
+  });
+
+  it('should abort the multipart upload on failure', async () => {
+    const { r2, upload } = createR2();
+    upload.uploadPart.mockRejectedValueOnce(new Error('R2 part failed'));
+
+    await expect(uploadStreamToR2(r2, 'k', new Blob(['0123456789']).stream(), { partSize: 4 })).rejects.toThrow('R2 part failed');
+    expect(upload.abort).toHaveBeenCalled();
+  });
+});
+
+describe('streamRowsToR2', () => {
+  it('should gzip and count raw and stored bytes', async () => {
+    const { r2 } = createR2();
+    const rows = Array.from({ length: 50 }, (_, i) => ({ id: i, note: 'x'.repeat(100) }));
+
+    const result = await streamRowsToR2(r2, 'backups/leads/2026-03-05.jsonl.gz', pagesOf(rows), { gzip: true, pageSize: 20 });
+
+    expect(result.rows).toBe(50);
+    expect(result.storedBytes).toBeLessThan(result.bytes);
+    expect(r2.put.mock.calls[0][2]).toEqual({ httpMetadata: { contentType: 'application/gzip' } });
+
+    const gz = r2.put.mock.calls[0][1] as Uint8Array;
+    const text = new TextDecoder().decode(await readAll(new Blob([gz]).stream().pipeThrough(new DecompressionStream('gzip'))));
+    expect(text.trim().split('\n')).toHaveLength(50);
+  });
+});
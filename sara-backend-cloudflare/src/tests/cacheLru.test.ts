@@ -0,0 +1,161 @@
+import { describe, it, expect, vi, beforeEach, afterEach } from 'vitest';
+import { CacheService, CACHE_SWEEP_INTERVAL_MS, CACHE_TAG_CHECK_MS, resetCacheIsolateState, getCacheService, resetCacheService } from '../services/cacheService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// CACHE LRU + REGISTRO DE VERSIONES POR TAG (KV compartido entre isolates)
+// ═══════════════════════════════════════════════════════════════════════════
+
+const T0 = new Date('2026-03-05T12:00:00Z').getTime();
+
+function createMockKV() {
+  const store = new Map<string, string>();
+  return {
+    store,
+    get: vi.fn(async (key: string) => store.get(key) ?? null),
+    put: vi.fn(async (key: string, value: string) => { store.set(key, value); }),
+    delete: vi.fn(async (key: string) => { store.delete(key); }),
+  };
+}
+
+beforeEach(() => {
+  resetCacheIsolateState();
+  resetCacheService();
+});
+
+afterEach(() => {
+  vi.useRealTimers();
+});
+
+describe('CacheService memory LRU', () => {
+  it('evicts the least recently used entry past maxEntries', async () => {
+    const cache = new CacheService(null, undefined, { maxEntries: 2 });
+    await cache.set('a', 1, { ttl: 60 });
+    await cache.set('b', 2, { ttl: 60 });
+    await cache.get('a'); // 'a' pasa a ser la más reciente
+    await cache.set('c', 3, { ttl: 60 });
+
+    expect(await cache.get('a')).toBe(1);
+    expect(await cache.get('b')).toBeNull();
+    expect(cache.getStats()).toMatchObject({ totalKeys: 2, evictions: 1 });
+  });
+
+  it('bounds approximate bytes and skips entries larger than the tier', async () => {
+    const cache = new CacheService(null, undefined, { maxBytes: 1000 });
+    await cache.set('small1', 'x'.repeat(150), { ttl: 60 });
+    await cache.set('small2', 'x'.repeat(150), { ttl: 60 });
+    await cache.set('small3', 'x'.repeat(150), { ttl: 60 });
+    await cache.set('huge', 'x'.repeat(2000), { ttl: 60 });
+
+    const stats = cache.getStats();
+    expect(stats.memoryBytes).toBeLessThanOrEqual(1000);
+    expect(stats.evictions).toBeGreaterThan(0);
+    expect(await cache.get('huge')).toBeNull();
+    expect(await cache.get('small3')).toBe('x'.repeat(150));
+  });
+
+  it('sweeps expired entries lazily on writes', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const cache = new CacheService(null);
+    await cache.set('old', 1, { ttl: 10 });
+
+    vi.setSystemTime(T0 + CACHE_SWEEP_INTERVAL_MS + 1);
+    await cache.set('new', 2, { ttl: 60 });
+
+    expect(cache.getStats()).toMatchObject({ totalKeys: 1, expired: 1 });
+  });
+
+  it('tracks hits, misses and size per key', async () => {
+    const cache = new CacheService(null);
+    const fetcher = vi.fn().mockResolvedValue({ n: 1 });
+    await cache.getOrFetch('k', fetcher, { ttl: 60 });
+    await cache.getOrFetch('k', fetcher, { ttl: 60 });
+    await cache.get('other');
+
+    const { perKey } = cache.getStats();
+    expect(perKey.k).toMatchObject({ hits: 1, misses: 1, staleHits: 0 });
+    expect(perKey.k.bytes).toBeGreaterThan(0);
+    expect(perKey.other).toMatchObject({ hits: 0, misses: 1, bytes: 0 });
+  });
+});
+
+describe('CacheService tag invalidation across isolates', () => {
+  it('drops entries in other isolates once they re-check the tag version', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const kv = createMockKV();
+    const isolateA = new CacheService(kv as any);
+    const isolateB = new CacheService(kv as any);
+    const fetcher = vi.fn().mockResolvedValueOnce(['v1']).mockResolvedValueOnce(['v2']);
+    const config = { ttl: 300, tags: ['properties'] };
+
+    await isolateA.getOrFetch('props', fetcher, config);
+    expect(await isolateB.getOrFetch('props', fetcher, config)).toEqual(['v1']); // desde KV
+
+    vi.setSystemTime(T0 + 1000);
+    await isolateA.invalidateByTag('properties');
+    resetCacheIsolateState(); // B corre en otro isolate: no vio el bump en memoria
+
+    vi.setSystemTime(T0 + 1000 + CACHE_TAG_CHECK_MS);
+    expect(await isolateB.getOrFetch('props', fetcher, config)).toEqual(['v2']);
+    expect(fetcher).toHaveBeenCalledTimes(2);
+    expect(isolateA.getStats().tagInvalidations).toBe(1);
+  });
+
+  it('does not stamp a fetch that raced an invalidation as current', async () => {
+    const kv = createMockKV();
+    const cache = new CacheService(kv as any);
+    let resolve!: (v: string) => void;
+    const fetcher = vi.fn(() => new Promise<string>(r => { resolve = r; }));
+    const config = { ttl: 300, tags: ['team'] };
+
+    const pending = cache.getOrFetch('roster', fetcher, config);
+    await vi.waitFor(() => expect(fetcher).toHaveBeenCalled());
+    await cache.invalidateByTag('team');
+    resolve('old');
+    await pending;
+
+    expect(await cache.get('roster')).toBeNull();
+  });
+
+  it('invalidateAll reaches entries without tags', async () => {
+    const kv = createMockKV();
+    const isolateA = new CacheService(kv as any);
+    const isolateB = new CacheService(kv as any);
+    await isolateA.set('k', 'v1', { ttl: 300 });
+
+    await isolateB.invalidateAll();
+
+    expect(await isolateB.get('k')).toBeNull();
+    expect(kv.store.has('cache:tagv:__all__')).toBe(true);
+  });
+
+  it('shares tag versions between instances of the same isolate', async () => {
+    const kv = createMockKV();
+    const config = { ttl: 300, tags: ['properties'] };
+    const first = new CacheService(kv as any);
+    await first.getOrFetch('props', async () => ['v1'], config);
+    const tagReads = kv.get.mock.calls.filter(([key]) => key.startsWith('cache:tagv:')).length;
+
+    // Otra request del mismo isolate: la versión ya leída no vuelve a KV
+    const second = new CacheService(kv as any);
+    expect(await second.getOrFetch('props', async () => ['v2'], config)).toEqual(['v1']);
+    expect(kv.get.mock.calls.filter(([key]) => key.startsWith('cache:tagv:')).length).toBe(tagReads);
+  });
+});
+
+describe('getCacheService', () => {
+  it('keeps one instance per KV binding so the memory tier outlives the request', async () => {
+    const kv = createMockKV();
+    const requestA = getCacheService(kv as any, () => {});
+    await requestA.set('k', 'v1', { ttl: 300 });
+
+    const waitUntilB = vi.fn();
+    const requestB = getCacheService(kv as any, waitUntilB);
+    expect(requestB).toBe(requestA);
+    expect(await requestB.get('k')).toBe('v1');
+    expect(kv.get).not.toHaveBeenCalledWith('cache:v1:k'); // desde memoria
+    expect(requestB.getStats().perKey.k.hits).toBe(1);
+    expect(getCacheService(createMockKV() as any)).not.toBe(requestA);
+  });
+});
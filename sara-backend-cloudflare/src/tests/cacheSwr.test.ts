@@ -0,0 +1,216 @@
+import { describe, it, expect, vi, beforeEach, afterEach } from 'vitest';
+import { CacheService, resetCacheIsolateState } from '../services/cacheService';
+import { getCachedAnalyticsDashboard } from '../crons/dashboard';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// CACHE STALE-WHILE-REVALIDATE + SINGLE-FLIGHT + EARLY REFRESH TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+const T0 = new Date('2026-03-05T12:00:00Z').getTime();
+
+beforeEach(() => {
+  resetCacheIsolateState(); // los tests reusan la key 'k' entre instancias
+});
+
+afterEach(() => {
+  vi.useRealTimers();
+});
+
+describe('CacheService.getOrFetch SWR', () => {
+  it('should serve fresh entries without calling the fetcher', async () => {
+    const cache = new CacheService(null);
+    const fetcher = vi.fn().mockResolvedValue('v1');
+
+    expect(await cache.getOrFetch('k', fetcher, { ttl: 60 })).toBe('v1');
+    expect(await cache.getOrFetch('k', fetcher, { ttl: 60 })).toBe('v1');
+    expect(fetcher).toHaveBeenCalledTimes(1);
+  });
+
+  it('should return stale data and refresh in background via waitUntil', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const pending: Promise<any>[] = [];
+    const cache = new CacheService(null, p => { pending.push(p); });
+    const fetcher = vi.fn().mockResolvedValueOnce('v1').mockResolvedValueOnce('v2');
+    const config = { ttl: 60, staleWhileRevalidate: 300 };
+
+    await cache.getOrFetch('k', fetcher, config);
+    vi.setSystemTime(T0 + 90_000); // vencido, dentro de la ventana stale
+
+    expect(await cache.getOrFetch('k', fetcher, config)).toBe('v1');
+    expect(pending).toHaveLength(1);
+    await Promise.all(pending);
+
+    expect(fetcher).toHaveBeenCalledTimes(2);
+    expect(await cache.getOrFetch('k', fetcher, config)).toBe('v2');
+    expect(cache.getStats()).toMatchObject({ hits: 1, staleHits: 1, misses: 1, revalidations: 2 });
+  });
+
+  it('should treat entries past the stale window as misses', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const cache = new CacheService(null);
+    const fetcher = vi.fn().mockResolvedValueOnce('v1').mockResolvedValueOnce('v2');
+
+    await cache.getOrFetch('k', fetcher, { ttl: 60, staleWhileRevalidate: 60 });
+    vi.setSystemTime(T0 + 200_000);
+
+    expect(await cache.getOrFetch('k', fetcher, { ttl: 60, staleWhileRevalidate: 60 })).toBe('v2');
+    expect(await cache.get('missing')).toBeNull();
+  });
+
+  it('get() should not return stale entries', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const cache = new CacheService(null);
+    await cache.set('k', 'v1', { ttl: 60, staleWhileRevalidate: 300 });
+    vi.setSystemTime(T0 + 90_000);
+
+    expect(await cache.get('k')).toBeNull();
+  });
+
+  it('should share one fetch between concurrent misses (single-flight)', async () => {
+    const cache = new CacheService(null);
+    let resolve!: (v: string) => void;
+    const gate = new Promise<string>(r => { resolve = r; });
+    const fetcher = vi.fn(() => gate);
+
+    const a = cache.getOrFetch('k', fetcher, { ttl: 60 });
+    const b = cache.getOrFetch('k', fetcher, { ttl: 60 });
+    resolve('v1');
+
+    expect(await Promise.all([a, b])).toEqual(['v1', 'v1']);
+    expect(fetcher).toHaveBeenCalledTimes(1);
+  });
+
+  it('should count callers coalesced onto an in-flight fetch', async () => {
+    const cache = new CacheService(null);
+    let resolve!: (v: string) => void;
+    const gate = new Promise<string>(r => { resolve = r; });
+    const fetcher = vi.fn(() => gate);
+
+    const burst = Array.from({ length: 5 }, () => cache.getOrFetch('properties:all', fetcher, { ttl: 60 }));
+    resolve('v1');
+    await Promise.all(burst);
+
+    expect(fetcher).toHaveBeenCalledTimes(1);
+    expect(cache.getStats()).toMatchObject({ misses: 5, revalidations: 1, coalesced: 4 });
+  });
+
+  it('should share one fetch between request-scoped instances of the isolate', async () => {
+    const requestA = new CacheService(null);
+    const requestB = new CacheService(null);
+    let resolve!: (v: string) => void;
+    const gate = new Promise<string>(r => { resolve = r; });
+    const fetcher = vi.fn(() => gate);
+
+    const a = requestA.getOrFetch('dashboard', fetcher, { ttl: 60 });
+    const b = requestB.getOrFetch('dashboard', fetcher, { ttl: 60 });
+    resolve('v1');
+
+    expect(await Promise.all([a, b])).toEqual(['v1', 'v1']);
+    expect(fetcher).toHaveBeenCalledTimes(1);
+    expect(requestB.getStats().coalesced).toBe(1);
+  });
+
+  it('should release the in-flight slot when the fetcher fails', async () => {
+    const cache = new CacheService(null);
+    const fetcher = vi.fn().mockRejectedValueOnce(new Error('db down')).mockResolvedValueOnce('ok');
+
+    await expect(cache.getOrFetch('k', fetcher, { ttl: 60 })).rejects.toThrow('db down');
+    expect(await cache.getOrFetch('k', fetcher, { ttl: 60 })).toBe('ok');
+  });
+});
+
+describe('CacheService.getOrFetch early refresh', () => {
+  afterEach(() => {
+    vi.restoreAllMocks();
+  });
+
+  // Fetch de 2s con TTL de 60s: el refresh anticipado solo puede caer al final
+  function slowFetcher(...values: string[]) {
+    let calls = 0;
+    return vi.fn(async () => {
+      vi.setSystemTime(Date.now() + 2000);
+      return values[calls++];
+    });
+  }
+
+  it('should refresh a hot key in background shortly before it expires', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const pending: Promise<any>[] = [];
+    const cache = new CacheService(null, p => { pending.push(p); });
+    const fetcher = slowFetcher('v1', 'v2');
+    await cache.getOrFetch('k', fetcher, { ttl: 60 });
+
+    vi.spyOn(Math, 'random').mockReturnValue(0.1); // -ln(0.1) ≈ 2.3 → ventana de ~4.6s
+    vi.setSystemTime(T0 + 2000 + 30_000);
+    expect(await cache.getOrFetch('k', fetcher, { ttl: 60 })).toBe('v1');
+    expect(pending).toHaveLength(0);
+
+    vi.setSystemTime(T0 + 2000 + 57_000);
+    expect(await cache.getOrFetch('k', fetcher, { ttl: 60 })).toBe('v1');
+    expect(pending).toHaveLength(1);
+    await Promise.all(pending);
+
+    expect(fetcher).toHaveBeenCalledTimes(2);
+    expect(await cache.getOrFetch('k', fetcher, { ttl: 60 })).toBe('v2');
+    expect(cache.getStats()).toMatchObject({ earlyRefreshes: 1, misses: 1 });
+  });
+
+  it('should not start a second early refresh while one is in flight', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const pending: Promise<any>[] = [];
+    const cache = new CacheService(null, p => { pending.push(p); });
+    const fetcher = slowFetcher('v1', 'v2');
+    await cache.getOrFetch('k', fetcher, { ttl: 60 });
+
+    vi.spyOn(Math, 'random').mockReturnValue(0.01);
+    vi.setSystemTime(T0 + 2000 + 55_000);
+    await Promise.all([cache.getOrFetch('k', fetcher, { ttl: 60 }), cache.getOrFetch('k', fetcher, { ttl: 60 })]);
+    await Promise.all(pending);
+
+    expect(fetcher).toHaveBeenCalledTimes(2);
+    expect(cache.getStats().earlyRefreshes).toBe(1);
+  });
+
+  it('should be disabled with earlyRefreshBeta = 0', async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(T0);
+    const cache = new CacheService(null);
+    const fetcher = slowFetcher('v1', 'v2');
+    const config = { ttl: 60, earlyRefreshBeta: 0 };
+    await cache.getOrFetch('k', fetcher, config);
+
+    vi.spyOn(Math, 'random').mockReturnValue(0.0001);
+    vi.setSystemTime(T0 + 2000 + 59_000);
+    await cache.getOrFetch('k', fetcher, config);
+
+    expect(fetcher).toHaveBeenCalledTimes(1);
+    expect(cache.getStats().earlyRefreshes).toBe(0);
+  });
+});
+
+describe('getCachedAnalyticsDashboard', () => {
+  it('should query leads once per tenant and period while fresh', async () => {
+    const from = vi.fn((table: string) => {
+      const result = table === 'leads'
+        ? { data: [{ id: 'l1', status: 'ganado', source: 'Facebook', created_at: new Date().toISOString(), assigned_to: 'v1' }], error: null }
+        : { data: [{ id: 'v1', name: 'Javier' }], error: null };
+      const chain: any = { select: () => chain, gte: () => chain, eq: () => chain, then: (res: any) => res(result) };
+      return chain;
+    });
+    const supabase = { client: { from }, getTenantId: () => 't1' } as any;
+    const cache = new CacheService(null);
+
+    const first = await getCachedAnalyticsDashboard(supabase, cache, 30);
+    const second = await getCachedAnalyticsDashboard(supabase, cache, 30);
+
+    expect(first.funnel.leads_converted).toBe(1);
+    expect(first.top_sellers[0]).toMatchObject({ name: 'Javier', sales: 1 });
+    expect(second).toBe(first);
+    expect(from.mock.calls.filter(c => c[0] === 'leads')).toHaveLength(1);
+  });
+});
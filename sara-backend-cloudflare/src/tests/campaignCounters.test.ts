@@ -0,0 +1,124 @@
+import { describe, it, expect, vi } from 'vitest';
+import { CampaignCounterBuffer } from '../services/campaignCounterService';
+import { AgenciaReportingService } from '../services/agenciaReportingService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// CAMPAIGN COUNTERS TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function createSupabase(rpcResult: Record<string, any> = {}, tables: Record<string, any> = {}) {
+  const inserts: { table: string; rows: any }[] = [];
+  const rpc = vi.fn(async (name: string, _args?: any) => rpcResult[name] || { data: null, error: null });
+  const from = vi.fn((table: string) => {
+    const chain: any = {};
+    for (const m of ['select', 'eq', 'gte', 'in', 'order', 'limit', 'update']) chain[m] = () => chain;
+    const result = tables[table] || { data: [], error: null };
+    chain.insert = (rows: any) => {
+      inserts.push({ table, rows });
+      return table === 'campaigns' ? chain : Promise.resolve({ error: null });
+    };
+    chain.single = () => Promise.resolve(table === 'campaigns' ? { data: { id: 'camp-1' }, error: null } : result);
+    chain.then = (resolve: any) => resolve(result);
+    return chain;
+  });
+  return { supabase: { client: { from, rpc } } as any, rpc, from, inserts };
+}
+
+describe('CampaignCounterBuffer', () => {
+  it('should merge deltas per campaign and write them in one RPC', async () => {
+    const { supabase, rpc } = createSupabase();
+    const buffer = new CampaignCounterBuffer(supabase);
+
+    buffer.bump('c1', { sent: 1 });
+    buffer.bump('c1', { sent: 1, failed: 1 });
+    buffer.bump('c2', { sent: 1 });
+    buffer.addStatus('wamid.1', 'delivered');
+    buffer.addStatus('wamid.2', 'sent');
+    buffer.addReply('5215512345678');
+    await buffer.flush();
+
+    expect(rpc).toHaveBeenCalledTimes(2);
+    expect(rpc).toHaveBeenCalledWith('bump_campaign_counters', {
+      p_rows: [{ campaign_id: 'c1', sent: 2, failed: 1 }, { campaign_id: 'c2', sent: 1 }]
+    });
+    expect(rpc).toHaveBeenCalledWith('record_campaign_events', {
+      p_statuses: [{ message_id: 'wamid.1', status: 'delivered' }],
+      p_phones: ['5215512345678']
+    });
+    expect(buffer.getStats()).toEqual({ pending: 0, flushes: 1, rpcCalls: 2 });
+  });
+
+  it('should flush early once maxSize events are pending', async () => {
+    const { supabase, rpc } = createSupabase();
+    const buffer = new CampaignCounterBuffer(supabase, { maxSize: 3 });
+
+    for (let i = 0; i < 3; i++) buffer.addStatus(`wamid.${i}`, 'read');
+    await buffer.flush();
+
+    expect(rpc).toHaveBeenCalledTimes(1);
+    expect(rpc.mock.calls[0][1].p_statuses).toHaveLength(3);
+  });
+});
+
+describe('AgenciaReportingService counters', () => {
+  const SOURCES = [
+    { source: 'Facebook', leads: 6, scheduled: 2, visited: 1, hot: 3, won: 1, revenue: 2_500_000 },
+    { source: 'Directo', leads: 4, scheduled: 1, visited: 0, hot: 1, won: 1, revenue: 2_000_000 }
+  ];
+
+  it('should build leads by source from counters without reading leads', async () => {
+    const { supabase, from } = createSupabase({ marketing_source_summary: { data: SOURCES, error: null } });
+
+    const { metrics, total } = await new AgenciaReportingService(supabase).getLeadsPorFuente();
+
+    expect(from).not.toHaveBeenCalledWith('leads');
+    expect(total).toBe(10);
+    expect(metrics[0]).toEqual({ fuente: 'Facebook', total: 6, hot: 3, conversion: 50 });
+  });
+
+  it('should compute ROI from source revenue and campaign cost counters', async () => {
+    const { supabase, from } = createSupabase(
+      { marketing_source_summary: { data: SOURCES, error: null } },
+      { campaign_counters: { data: [{ sent: 10, delivered: 8, read: 5, replied: 2, cost: 150_000 }], error: null } }
+    );
+
+    const msg = await new AgenciaReportingService(supabase).getROI();
+
+    expect(from).not.toHaveBeenCalledWith('leads');
+    expect(msg).toContain('Invertido: $150,000');
+    expect(msg).toContain('Revenue: $4.5M');
+    expect(msg).toContain('ROI: 2900%');
+  });
+
+  it('should fall back to leads when the counters migration is missing', async () => {
+    const { supabase, from } = createSupabase(
+      { marketing_source_summary: { data: null, error: { code: 'PGRST202', message: 'missing' } } },
+      { leads: { data: [{ source: 'Google', status: 'reserved' }, { source: null, status: 'new' }], error: null } }
+    );
+
+    const { metrics, total } = await new AgenciaReportingService(supabase).getLeadsPorFuente();
+
+    expect(from).toHaveBeenCalledWith('leads');
+    expect(total).toBe(2);
+    expect(metrics.map(m => m.fuente).sort()).toEqual(['Directo', 'Google']);
+  });
+
+  it('should insert broadcast logs in batches and count sends per campaign', async () => {
+    const { supabase, rpc, inserts } = createSupabase();
+    const leads = Array.from({ length: 60 }, (_, i) => ({
+      id: `l${i}`, name: `Lead ${i}`, phone: `52155500000${String(i).padStart(2, '0')}`, last_message_at: new Date().toISOString()
+    }));
+    const enviar = vi.fn(async () => ({ messages: [{ id: 'wamid.x' }] }));
+
+    // Sin la pausa de 100ms entre envíos
+    const timeout = vi.spyOn(globalThis, 'setTimeout').mockImplementation(((fn: () => void) => { fn(); return 0; }) as any);
+    const result = await new AgenciaReportingService(supabase).ejecutarEnvioBroadcast(leads, 'Hola {nombre}', 'todos', 'u1', enviar);
+    timeout.mockRestore();
+
+    const logInserts = inserts.filter(i => i.table === 'campaign_logs');
+    expect(result.enviados).toBe(60);
+    expect(logInserts.map(i => i.rows.length)).toEqual([50, 10]);
+    expect(logInserts[0].rows[0]).toMatchObject({ campaign_id: 'camp-1', message_id: 'wamid.x', status: 'sent' });
+    expect(rpc).toHaveBeenCalledWith('bump_campaign_counters', { p_rows: [{ campaign_id: 'camp-1', sent: 60 }] });
+  });
+});
@@ -0,0 +1,121 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  classifyUserMessage,
+  recordConversationIntents,
+  getIntentCounts
+} from '../services/conversationIntentService';
+import { handleApiBiRoutes } from '../routes/api-bi';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// CONVERSATION INTENT COUNTERS + BI AGGREGATION TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+const corsResponse = (body: string, status = 200) => new Response(body, { status });
+const checkApiAuth = () => null; // API key válida
+
+describe('classifyUserMessage', () => {
+  it('should pick the first matching intent', () => {
+    expect(classifyUserMessage('Hola, cuánto cuesta?').intent).toBe('saludo');
+    expect(classifyUserMessage('Qué precio tiene la casa').intent).toBe('precio');
+    expect(classifyUserMessage('Acepta infonavit?').intent).toBe('credito');
+    expect(classifyUserMessage('ok').intent).toBe('otro');
+  });
+
+  it('should collect every objection in the message', () => {
+    expect(classifyUserMessage('Está muy caro, lo voy a pensar').objections).toEqual(['muy caro', 'lo voy a pensar']);
+    expect(classifyUserMessage('gracias').objections).toEqual([]);
+  });
+});
+
+describe('recordConversationIntents', () => {
+  it('should increment intent and objection counters in one RPC', async () => {
+    const rpc = vi.fn().mockResolvedValue({ error: null });
+    await recordConversationIntents({ client: { rpc } } as any, 'Muy caro', new Date('2026-03-05T12:00:00Z'));
+
+    expect(rpc).toHaveBeenCalledTimes(1);
+    expect(rpc).toHaveBeenCalledWith('increment_conversation_intents', {
+      p_day: '2026-03-05',
+      p_items: [
+        { kind: 'intent', label: 'objecion', count: 1 },
+        { kind: 'objection', label: 'muy caro', count: 1 }
+      ]
+    });
+  });
+
+  it('should never throw on ingest', async () => {
+    const rpc = vi.fn().mockRejectedValue(new Error('network'));
+    await expect(recordConversationIntents({ client: { rpc } } as any, 'hola')).resolves.toBeUndefined();
+  });
+});
+
+describe('getIntentCounts', () => {
+  it('should sum daily counters into the response dictionaries', async () => {
+    const gte = vi.fn().mockResolvedValue({
+      data: [
+        { kind: 'intent', label: 'precio', count: 4 },
+        { kind: 'intent', label: 'precio', count: 2 },
+        { kind: 'objection', label: 'no me alcanza', count: 1 },
+        { kind: 'intent', label: 'desconocida', count: 9 }
+      ],
+      error: null
+    });
+    const supabase = { client: { from: () => ({ select: () => ({ gte }) }) } } as any;
+
+    const counts = await getIntentCounts(supabase, '2026-03-01');
+
+    expect(gte).toHaveBeenCalledWith('day', '2026-03-01');
+    expect(counts!.intenciones.precio).toBe(6);
+    expect(counts!.objeciones['no me alcanza']).toBe(1);
+  });
+});
+
+describe('BI aggregation endpoints', () => {
+  it('/api/dashboard/kpis should use the GROUP BY RPC instead of downloading leads', async () => {
+    const rpc = vi.fn().mockResolvedValue({ data: [{ key: 'new', count: 7 }, { key: 'contacted', count: 3 }], error: null });
+    const from = vi.fn();
+    const supabase = { client: { rpc, from } } as any;
+
+    const res = await handleApiBiRoutes(
+      new URL('https://sara.test/api/dashboard/kpis'), new Request('https://sara.test/api/dashboard/kpis'),
+      {} as any, supabase, {} as any, corsResponse, checkApiAuth
+    );
+
+    expect(rpc).toHaveBeenCalledWith('bi_lead_counts', { p_dimension: 'status', p_since: null });
+    expect(from).not.toHaveBeenCalled();
+    expect(await res!.json()).toMatchObject({ total: 10, new: 7, contacted: 3, qualified: 0 });
+  });
+
+  it('/api/metrics/conversation should combine the SQL summary with ingest counters', async () => {
+    const rpc = vi.fn().mockResolvedValue({
+      data: {
+        leads_total: 10, con_conversacion: 4, total_mensajes: 40, mensajes_usuario: 20, mensajes_sara: 20,
+        por_status: { new: 6, visited: 2, sold: 1 }, por_fuente: { Facebook: 10 },
+        desarrollos_populares: [{ nombre: 'Monte Verde', count: 5 }],
+        citas: { total: 5, completadas: 4, no_show: 1, canceladas: 0 }
+      },
+      error: null
+    });
+    const gte = vi.fn().mockResolvedValue({ data: [{ kind: 'intent', label: 'cita', count: 3 }], error: null });
+    const from = vi.fn((table: string) => {
+      expect(table).toBe('conversation_intent_counts');
+      return { select: () => ({ gte }) };
+    });
+    const supabase = { client: { rpc, from } } as any;
+
+    const url = new URL('https://sara.test/api/metrics/conversation?days=30');
+    const res = await handleApiBiRoutes(url, new Request(url), {} as any, supabase, {} as any, corsResponse, checkApiAuth);
+    const body = await res!.json();
+
+    expect(body.leads).toMatchObject({ total: 10, con_conversacion: 4, sin_conversacion: 6 });
+    expect(body.conversaciones.promedio_por_lead).toBe(10);
+    expect(body.intenciones.cita).toBe(3);
+    expect(body.citas.tasa_completacion).toBe(80);
+    expect(body.conversion).toMatchObject({ lead_a_cita: 50, lead_a_visita: 20, lead_a_venta: 10 });
+  });
+
+  it('/api/metrics/leads/aggregate should reject dimensions outside the whitelist', async () => {
+    const url = new URL('https://sara.test/api/metrics/leads/aggregate?by=phone');
+    const res = await handleApiBiRoutes(url, new Request(url), {} as any, { client: { rpc: vi.fn() } } as any, {} as any, corsResponse, checkApiAuth);
+    expect(res!.status).toBe(400);
+  });
+});
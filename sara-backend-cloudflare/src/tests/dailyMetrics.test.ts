@@ -0,0 +1,126 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  DailyMetricsService,
+  summarizeDailyMetrics,
+  summarizeRawByVendedor,
+  avgResponseMinutes,
+  UNASSIGNED_VENDEDOR,
+  toDayKey,
+  DailyMetricsRow
+} from '../services/dailyMetricsService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// DAILY METRICS ROLLUP TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function row(day: string, overrides: Partial<DailyMetricsRow> = {}): DailyMetricsRow {
+  return {
+    day,
+    vendedor_id: 'v1',
+    development: 'Monte Verde',
+    source: 'Facebook',
+    leads_created: 0,
+    leads_lost: 0,
+    sales_closed: 0,
+    revenue: 0,
+    first_response_count: 0,
+    first_response_minutes: 0,
+    appointments_total: 0,
+    appointments_completed: 0,
+    appointments_no_show: 0,
+    appointments_cancelled: 0,
+    ...overrides
+  };
+}
+
+function createRangeSupabase(pages: any[][], error: any = null, backfilled: any = { backfilled_at: '2026-03-01T00:00:00Z' }) {
+  const range = vi.fn(async (from: number) => {
+    if (error) return { data: null, error };
+    return { data: pages[Math.floor(from / 1000)] || [], error: null };
+  });
+  const chain: any = { select: () => chain, gte: () => chain, lte: () => chain, order: () => chain, range };
+  const marker: any = {
+    select: () => marker,
+    limit: () => marker,
+    maybeSingle: async () => (error ? { data: null, error } : { data: backfilled, error: null })
+  };
+  const from = vi.fn((table: string) => (table === 'daily_metrics_backfill' ? marker : chain));
+  return { supabase: { client: { from } } as any, range };
+}
+
+describe('summarizeDailyMetrics', () => {
+  const rows = [
+    row('2026-03-01', { leads_created: 3, sales_closed: 1, revenue: 2_000_000, first_response_count: 2, first_response_minutes: 30 }),
+    row('2026-03-01', { vendedor_id: 'v2', source: 'Google', leads_created: 2, appointments_total: 2, appointments_completed: 1 }),
+    row('2026-03-02', { leads_created: 1, leads_lost: 1, revenue: '1500000' as any, sales_closed: 1 })
+  ];
+
+  it('should sum totals and break down by vendedor, development and source', () => {
+    const summary = summarizeDailyMetrics(rows);
+    expect(summary.totals).toMatchObject({ leads: 6, sales: 2, revenue: 3_500_000, lost: 1, appointments: 2 });
+    expect(summary.byVendedor.v1.leads).toBe(4);
+    expect(summary.byVendedor.v2.appointmentsCompleted).toBe(1);
+    expect(summary.bySource.Google.leads).toBe(2);
+    expect(summary.byDevelopment['Monte Verde'].sales).toBe(2);
+  });
+
+  it('should restrict to an inclusive day range', () => {
+    expect(summarizeDailyMetrics(rows, '2026-03-02', '2026-03-02').totals.leads).toBe(1);
+    expect(summarizeDailyMetrics(rows, '2026-03-01', '2026-03-01').totals.leads).toBe(5);
+  });
+
+  it('should average first response minutes', () => {
+    expect(avgResponseMinutes(summarizeDailyMetrics(rows).totals)).toBe(15);
+    expect(avgResponseMinutes(summarizeDailyMetrics([]).totals)).toBe(0);
+  });
+
+  it('toDayKey should use the UTC day', () => {
+    expect(toDayKey('2026-03-01T23:30:00.000Z')).toBe('2026-03-01');
+  });
+});
+
+describe('summarizeRawByVendedor', () => {
+  it('should apply the same rules as the rollup triggers', () => {
+    const leads = [
+      { assigned_to: 'v1', created_at: '2026-03-01T10:00:00Z', first_response_at: '2026-03-01T10:20:00Z' },
+      { assigned_to: 'v1', created_at: '2026-03-01T10:00:00Z', first_response_at: '2026-03-03T10:00:00Z' }, // >24h
+      { assigned_to: null, created_at: '2026-03-01T11:00:00Z' }
+    ];
+    const sales = [{ assigned_to: 'v1', properties: { price: 1_500_000 } }, { assigned_to: 'v2', properties: null }];
+    const appointments = [{ vendedor_id: 'v2', status: 'completed' }, { vendedor_id: 'v2', status: 'missed' }];
+
+    const summary = summarizeRawByVendedor(leads, sales, appointments);
+
+    expect(summary.totals).toMatchObject({ leads: 3, sales: 2, revenue: 3_500_000, appointments: 2 });
+    expect(avgResponseMinutes(summary.byVendedor.v1)).toBe(20);
+    expect(summary.byVendedor[UNASSIGNED_VENDEDOR].leads).toBe(1);
+    expect(summary.byVendedor.v2).toMatchObject({ revenue: 2_000_000, appointmentsCompleted: 1, appointmentsNoShow: 1 });
+  });
+});
+
+describe('DailyMetricsService.getRange', () => {
+  it('should page through the rollup until a short page', async () => {
+    const full = Array.from({ length: 1000 }, () => row('2026-03-01'));
+    const { supabase, range } = createRangeSupabase([full, [row('2026-03-02')]]);
+
+    const rows = await new DailyMetricsService(supabase).getRange('2026-03-01', '2026-03-31');
+
+    expect(rows).toHaveLength(1001);
+    expect(range).toHaveBeenCalledTimes(2);
+    expect(range).toHaveBeenLastCalledWith(1000, 1999);
+  });
+
+  it('should return null when the table is not migrated yet', async () => {
+    const { supabase } = createRangeSupabase([], { code: '42P01', message: 'relation "daily_metrics" does not exist' });
+
+    expect(await new DailyMetricsService(supabase).getRange('2026-03-01', '2026-03-31')).toBeNull();
+    expect(await new DailyMetricsService(supabase).summarize('2026-03-01', '2026-03-31')).toBeNull();
+  });
+
+  it('should return null until the tenant history is backfilled', async () => {
+    const { supabase, range } = createRangeSupabase([[row('2026-03-02')]], null, null);
+
+    expect(await new DailyMetricsService(supabase).getRange('2026-03-01', '2026-03-31')).toBeNull();
+    expect(range).not.toHaveBeenCalled();
+  });
+});
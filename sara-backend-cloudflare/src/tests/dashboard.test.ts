@@ -27,6 +27,7 @@ function createMockSupabase(responses: Record<string, any> = {}) {
         chain.in = vi.fn().mockReturnValue(chain);
         chain.order = vi.fn().mockReturnValue(chain);
         chain.limit = vi.fn().mockReturnValue(chain);
+        chain.range = vi.fn().mockReturnValue(chain);
         chain.single = vi.fn().mockResolvedValue(response);
         chain.maybeSingle = vi.fn().mockResolvedValue(response);
         chain.insert = vi.fn().mockReturnValue(chain);
@@ -867,6 +868,7 @@ describe('backupSemanalR2', () => {
         chain.order = vi.fn().mockReturnValue(chain);
         chain.in = vi.fn().mockReturnValue(chain);
         chain.limit = vi.fn().mockReturnValue(chain);
+        chain.range = vi.fn().mockReturnValue(chain);
         chain.then = (resolve: any) => resolve(resp);
         return chain;
       }
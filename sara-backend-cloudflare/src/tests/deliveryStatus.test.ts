@@ -0,0 +1,134 @@
+import { describe, it, expect, vi } from 'vitest';
+import { DeliveryStatusBuffer, toDeliveryStatusRow, advancesStatus } from '../services/deliveryStatusService';
+import { TTSTrackingService } from '../services/ttsTrackingService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// DELIVERY STATUS BUFFER TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function status(id: string, state: string, extra: any = {}) {
+  return { id, status: state, recipient_id: '5215512345678', timestamp: '1760000000', ...extra };
+}
+
+function createSupabase(rpcResult: any, tables: Record<string, any> = {}) {
+  const upserts: any[] = [];
+  const rpc = vi.fn(async () => rpcResult);
+  const from = vi.fn((table: string) => {
+    const chain: any = {};
+    for (const m of ['select', 'in', 'eq', 'update']) chain[m] = () => chain;
+    chain.upsert = (rows: any) => { upserts.push(rows); return Promise.resolve({ error: null }); };
+    chain.then = (resolve: any) => resolve(tables[table] || { data: [], error: null });
+    return chain;
+  });
+  return { supabase: { client: { rpc, from } } as any, rpc, from, upserts };
+}
+
+describe('DeliveryStatusBuffer', () => {
+  it('should collapse to the latest state per message and write one upsert', async () => {
+    const { supabase, rpc } = createSupabase({ data: [{ message_id: 'w1', status: 'read' }], error: null });
+    const onApplied = vi.fn(async () => {});
+    const buffer = new DeliveryStatusBuffer(supabase, { onApplied });
+
+    buffer.add(status('w1', 'sent'));
+    buffer.add(status('w1', 'read'));
+    buffer.add(status('w1', 'delivered')); // llega tarde: no retrocede
+    buffer.add(status('w2', 'delivered'));
+    buffer.add({ id: 'w3', status: 'deleted' }); // estado desconocido
+    await buffer.flush();
+
+    expect(rpc).toHaveBeenCalledTimes(1);
+    const rows = (rpc.mock.calls[0] as any)[1].p_rows;
+    expect(rows.map((r: any) => [r.message_id, r.status])).toEqual([['w1', 'read'], ['w2', 'delivered']]);
+    // w2 ya estaba en read en la DB: solo w1 avanzó
+    expect(onApplied).toHaveBeenCalledWith([expect.objectContaining({ message_id: 'w1', status: 'read' })]);
+    expect(buffer.getStats()).toEqual({ pending: 0, received: 4, flushes: 1, rowsApplied: 1 });
+  });
+
+  it('should skip statuses that do not advance when the RPC is missing', async () => {
+    const { supabase, upserts } = createSupabase(
+      { data: null, error: { code: 'PGRST202', message: 'missing' } },
+      { message_delivery_status: { data: [{ message_id: 'w1', status: 'read' }, { message_id: 'w2', status: 'sent' }], error: null } }
+    );
+    const onApplied = vi.fn(async () => {});
+    const buffer = new DeliveryStatusBuffer(supabase, { onApplied });
+
+    buffer.add(status('w1', 'delivered'));
+    buffer.add(status('w2', 'failed', { errors: [{ code: 131047, title: 'Re-engagement message' }] }));
+    await buffer.flush();
+
+    expect(upserts).toHaveLength(1);
+    expect(upserts[0]).toEqual([expect.objectContaining({ message_id: 'w2', status: 'failed', error_code: '131047' })]);
+    expect(onApplied).toHaveBeenCalledWith([expect.objectContaining({ message_id: 'w2' })]);
+  });
+
+  it('should reject flush on write errors only with throwOnError', async () => {
+    const rpcError = { data: null, error: { code: '57014', message: 'statement timeout' } };
+    const quiet = new DeliveryStatusBuffer(createSupabase(rpcError).supabase);
+    quiet.add(status('w1', 'read'));
+    await expect(quiet.flush()).resolves.toBeUndefined();
+
+    const onApplied = vi.fn(async () => {});
+    const strict = new DeliveryStatusBuffer(createSupabase(rpcError).supabase, { throwOnError: true, onApplied });
+    strict.add(status('w1', 'read'));
+    await expect(strict.flush()).rejects.toThrow('statement timeout');
+    expect(onApplied).not.toHaveBeenCalled();
+    await expect(strict.flush()).resolves.toBeUndefined(); // el error se reporta una vez
+  });
+
+  it('should flush early once maxSize message ids are pending', async () => {
+    const { supabase, rpc } = createSupabase({ data: [], error: null });
+    const buffer = new DeliveryStatusBuffer(supabase, { maxSize: 2 });
+
+    buffer.add(status('w1', 'sent'));
+    buffer.add(status('w1', 'delivered'));
+    expect(rpc).not.toHaveBeenCalled();
+    buffer.add(status('w2', 'sent'));
+    await buffer.flush();
+
+    expect(rpc).toHaveBeenCalledTimes(1);
+  });
+});
+
+describe('delivery status helpers', () => {
+  it('should rank read above delivered above sent, with failed terminal', () => {
+    expect(advancesStatus(null, 'sent')).toBe(true);
+    expect(advancesStatus('delivered', 'read')).toBe(true);
+    expect(advancesStatus('read', 'delivered')).toBe(false);
+    expect(advancesStatus('read', 'read')).toBe(false);
+    expect(advancesStatus('sent', 'failed')).toBe(true);
+  });
+
+  it('should map a Meta status into a table row', () => {
+    expect(toDeliveryStatusRow(status('w1', 'failed', { errors: [{ code: 131047, title: 'Window closed' }] }))).toEqual({
+      message_id: 'w1',
+      recipient_phone: '5215512345678',
+      status: 'failed',
+      timestamp: new Date(1760000000 * 1000).toISOString(),
+      error_code: '131047',
+      error_message: 'Window closed'
+    });
+  });
+});
+
+describe('TTSTrackingService.updateTTSStatuses', () => {
+  it('should update delivered and read messages with one query per state', async () => {
+    const inCalls: any[] = [];
+    const from = vi.fn(() => {
+      const chain: any = {};
+      chain.update = () => chain;
+      chain.in = (_col: string, ids: string[]) => { inCalls.push(ids); return chain; };
+      chain.select = () => Promise.resolve({ data: [], error: null });
+      return chain;
+    });
+    const tts = new TTSTrackingService({ client: { from } } as any);
+
+    await tts.updateTTSStatuses([
+      { message_id: 'w1', status: 'delivered' },
+      { message_id: 'w2', status: 'delivered' },
+      { message_id: 'w3', status: 'read' }
+    ]);
+
+    expect(from).toHaveBeenCalledTimes(2);
+    expect(inCalls).toEqual([['w1', 'w2'], ['w3']]);
+  });
+});
@@ -0,0 +1,204 @@
+import { describe, it, expect, vi, beforeEach } from 'vitest';
+import { EntityCache, getEntityCache, resetEntityCacheTier } from '../services/entityCache';
+import { CacheService, resetCacheIsolateState } from '../services/cacheService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// ENTITY CACHE TESTS (identity map por request/CRON sobre isolate + KV)
+// ═══════════════════════════════════════════════════════════════════════════
+
+const TEAM = [
+  { id: 'tm01', name: 'Ana', phone: '5215610000001', role: 'vendedor', notes: {} },
+  { id: 'tm02', name: 'Luis', phone: '5215610000002', role: 'asesor', notes: {} },
+];
+const PROPERTIES = [{ id: 'p1', name: 'Acacia' }];
+
+function createMockSupabase(tenantId = 'tenant-a') {
+  const queries: string[] = [];
+  let tenant = tenantId;
+
+  const from = vi.fn((table: string) => {
+    const rows = table === 'team_members' ? TEAM : PROPERTIES;
+    let filtered = rows.map((r: any) => ({ ...r }));
+    const chain: any = {
+      select: () => chain,
+      eq: (col: string, value: any) => {
+        if (col !== 'active') filtered = filtered.filter((r: any) => r[col] === value);
+        return chain;
+      },
+      like: (_col: string, pattern: string) => {
+        filtered = filtered.filter((r: any) => r.phone.endsWith(pattern.replace('%', '')));
+        return chain;
+      },
+      in: (_col: string, ids: string[]) => {
+        filtered = filtered.filter((r: any) => ids.includes(r.id));
+        return chain;
+      },
+      order: () => chain,
+      limit: () => chain,
+      maybeSingle: () => {
+        queries.push(table);
+        return Promise.resolve({ data: filtered[0] || null, error: null });
+      },
+      then: (resolve: any, reject: any) => {
+        queries.push(table);
+        return Promise.resolve({ data: filtered, error: null }).then(resolve, reject);
+      },
+    };
+    return chain;
+  });
+
+  const supabase = {
+    client: { from },
+    getTenantId: () => tenant,
+    setTenant: async (id: string) => { tenant = id; },
+  };
+  return { supabase: supabase as any, queries };
+}
+
+function createMockKV() {
+  const store = new Map<string, string>();
+  return {
+    store,
+    get: vi.fn(async (key: string, type?: string) => {
+      const raw = store.get(key);
+      if (raw === undefined) return null;
+      return type === 'json' ? JSON.parse(raw) : raw;
+    }),
+    put: vi.fn(async (key: string, value: string) => { store.set(key, value); }),
+    delete: vi.fn(async (key: string) => { store.delete(key); }),
+  };
+}
+
+beforeEach(() => {
+  resetEntityCacheTier();
+  resetCacheIsolateState();
+});
+
+describe('EntityCache', () => {
+  it('serves repeated lookups within one scope without new queries', async () => {
+    const { supabase, queries } = createMockSupabase();
+    const entities = new EntityCache(supabase);
+
+    await entities.getTeamMembers();
+    await entities.getTeamMembers();
+    await entities.getProperties();
+    await entities.getProperties();
+
+    expect(queries).toEqual(['team_members', 'properties']);
+    expect(entities.getStats()).toMatchObject({ lookups: 4, hits: 2, dbFetches: 2, hitRate: '50.0%' });
+  });
+
+  it('shares concurrent lookups of the same key', async () => {
+    const { supabase, queries } = createMockSupabase();
+    const entities = new EntityCache(supabase);
+
+    const [a, b] = await Promise.all([entities.getTeamMemberById('tm01'), entities.getTeamMemberById('tm01')]);
+
+    expect(a).toBe(b);
+    expect(queries).toHaveLength(1);
+  });
+
+  it('indexes a fresh roster by id and phone', async () => {
+    const { supabase, queries } = createMockSupabase();
+    const entities = new EntityCache(supabase);
+
+    await entities.getTeamMembers({ fresh: true });
+    const byId = await entities.getTeamMemberById('tm02');
+    const byPhone = await entities.getTeamMemberByPhone('+52 1 561 000 0001');
+
+    expect(byId.name).toBe('Luis');
+    expect(byPhone.name).toBe('Ana');
+    expect(queries).toEqual(['team_members']);
+  });
+
+  it('memoizes "not a team member" phone lookups', async () => {
+    const { supabase, queries } = createMockSupabase();
+    const entities = new EntityCache(supabase);
+
+    expect(await entities.getTeamMemberByPhone('5219999999999')).toBeNull();
+    expect(await entities.getTeamMemberByPhone('5219999999999')).toBeNull();
+    expect(queries).toHaveLength(1);
+  });
+
+  it('batches missing ids into a single query', async () => {
+    const { supabase, queries } = createMockSupabase();
+    const entities = new EntityCache(supabase);
+
+    await entities.getTeamMemberById('tm01');
+    const byId = await entities.getTeamMembersByIds(['tm01', 'tm02', 'tm02']);
+
+    expect([...byId.keys()].sort()).toEqual(['tm01', 'tm02']);
+    expect(queries).toHaveLength(2);
+  });
+
+  it('keeps rows coherent with patchTeamMember after a notes write', async () => {
+    const { supabase } = createMockSupabase();
+    const entities = new EntityCache(supabase);
+
+    await entities.getTeamMemberById('tm01');
+    entities.patchTeamMember('tm01', { notes: { pending_briefing: { sent_at: 'x' } } });
+
+    expect((await entities.getTeamMemberById('tm01')).notes).toEqual({ pending_briefing: { sent_at: 'x' } });
+  });
+
+  it('scopes keys by tenant', async () => {
+    const { supabase, queries } = createMockSupabase('tenant-a');
+    const entities = new EntityCache(supabase);
+
+    await entities.getProperties();
+    await supabase.setTenant('tenant-b');
+    await entities.getProperties();
+
+    expect(queries).toEqual(['properties', 'properties']);
+  });
+
+  it('serves a new scope from the isolate/KV tier', async () => {
+    const kv = createMockKV();
+    const first = createMockSupabase();
+    await getEntityCache(first.supabase, kv as any).getTeamMembers();
+
+    const second = createMockSupabase();
+    const entities = getEntityCache(second.supabase, kv as any);
+    await entities.getTeamMembers();
+
+    expect(second.queries).toHaveLength(0);
+    expect(entities.getStats()).toMatchObject({ lookups: 1, hits: 0, shared: 1, dbFetches: 0 });
+  });
+
+  it('invalidates scope, isolate and KV by tag on writes', async () => {
+    const kv = createMockKV();
+    const { supabase, queries } = createMockSupabase();
+    const entities = getEntityCache(supabase, kv as any);
+
+    await entities.getProperties();
+    await entities.invalidate('properties');
+    expect(kv.delete).toHaveBeenCalledTimes(1);
+
+    await entities.getProperties();
+    expect(queries).toEqual(['properties', 'properties']);
+  });
+
+  it('does not memoize roster errors', async () => {
+    const { supabase } = createMockSupabase();
+    const entities = new EntityCache(supabase, new CacheService(null));
+    const from = supabase.client.from;
+    supabase.client.from = vi.fn(() => {
+      const chain: any = {
+        select: () => chain,
+        eq: () => chain,
+        then: (resolve: any, reject: any) =>
+          Promise.resolve({ data: null, error: { message: 'DB down' } }).then(resolve, reject),
+      };
+      return chain;
+    });
+
+    await expect(entities.getTeamMembers()).rejects.toThrow('DB down');
+    supabase.client.from = from;
+    expect(await entities.getTeamMembers()).toHaveLength(2);
+  });
+
+  it('returns the same scope for the same SupabaseService', () => {
+    const { supabase } = createMockSupabase();
+    expect(getEntityCache(supabase)).toBe(getEntityCache(supabase));
+  });
+});
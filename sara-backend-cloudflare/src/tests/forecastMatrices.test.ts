@@ -0,0 +1,118 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  computeStageMatrices,
+  projectForecast,
+  createPropertyValueLookup,
+  getCachedForecast,
+  cohortKey,
+  FORECAST_STAGES,
+  FORECAST_MIN_SAMPLE
+} from '../services/forecastingService';
+import { CacheService } from '../services/cacheService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// FORECAST MATRICES + PROYECCIÓN TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+const NOW = new Date('2026-03-10T12:00:00Z');
+const S = FORECAST_STAGES.length;
+const NEGOTIATION = FORECAST_STAGES.indexOf('negotiation');
+const CLOSED = FORECAST_STAGES.indexOf('closed');
+
+function history(count: number, status: string, extra: any = {}) {
+  return Array.from({ length: count }, () => ({
+    status,
+    property_interest: 'Monte Verde',
+    source: 'Facebook',
+    created_at: '2026-01-01T00:00:00Z',
+    status_changed_at: '2026-03-01T12:00:00Z',
+    ...extra
+  }));
+}
+
+describe('computeStageMatrices', () => {
+  it('should count reached stages cumulatively and derive stage-to-stage conversion', () => {
+    const matrices = computeStageMatrices([...history(30, 'negotiation'), ...history(10, 'closed'), ...history(5, 'lost')], NOW);
+    const cohort = matrices.cohorts[cohortKey('monte verde', 'facebook')];
+
+    expect(cohort.sample).toBe(45);
+    expect(cohort.reached[0]).toBe(45); // lost solo cuenta como "new"
+    expect(cohort.reached[NEGOTIATION]).toBe(40);
+    expect(cohort.conversion[NEGOTIATION * S + CLOSED]).toBe(0.25);
+    expect(cohort.days_in_stage[NEGOTIATION]).toBe(9);
+    expect(matrices.day).toBe('2026-03-10');
+  });
+
+  it('should also fill the development and global fallback cohorts', () => {
+    const matrices = computeStageMatrices([...history(3, 'new'), ...history(2, 'new', { source: 'Google' })], NOW);
+
+    expect(matrices.cohorts[cohortKey('monte verde', '*')].sample).toBe(5);
+    expect(matrices.cohorts[cohortKey('*', '*')].sample).toBe(5);
+    expect(matrices.cohorts[cohortKey('monte verde', 'google')].sample).toBe(2);
+  });
+});
+
+describe('projectForecast', () => {
+  const properties = [{ id: 'p1', name: 'Monte Verde', price_min: 2_000_000, price_max: 2_000_000 }];
+
+  it('should use the cohort close rate when the sample is large enough', () => {
+    const matrices = computeStageMatrices([...history(30, 'negotiation'), ...history(10, 'closed')], NOW);
+    const result = projectForecast(history(2, 'negotiation'), properties, matrices, NOW);
+
+    expect(result.total_pipeline_value).toBe(4_000_000);
+    expect(result.weighted_forecast).toBe(1_000_000); // 0.25 en vez del peso fijo 0.70
+    expect(result.by_status).toEqual([{ status: 'negotiation', count: 2, total_value: 4_000_000, weight: 0.25, weighted_value: 1_000_000 }]);
+  });
+
+  it('should fall back to static weights below the minimum sample', () => {
+    const matrices = computeStageMatrices(history(FORECAST_MIN_SAMPLE - 1, 'negotiation'), NOW);
+    const result = projectForecast(history(1, 'negotiation'), properties, matrices, NOW);
+
+    expect(result.weighted_forecast).toBe(1_400_000);
+  });
+
+  it('should bucket expected closes by month using time in stage', () => {
+    // 9 días promedio en negotiation → cierre esperado dentro de marzo
+    const matrices = computeStageMatrices([...history(30, 'negotiation'), ...history(10, 'closed')], NOW);
+    const result = projectForecast(history(4, 'negotiation'), properties, matrices, NOW);
+
+    expect(result.monthly_projection.map(m => m.month)).toEqual(['2026-03', '2026-04', '2026-05']);
+    expect(result.monthly_projection[0]).toEqual({ month: '2026-03', projected_revenue: 2_000_000, projected_deals: 1 });
+    expect(result.monthly_projection[1].projected_deals).toBe(0);
+  });
+});
+
+describe('createPropertyValueLookup', () => {
+  it('should search properties once per distinct interest and keep the budget fallback', () => {
+    const properties = [{ name: 'Monte Verde', price_min: 1_000_000, price_max: 2_000_000 }];
+    const find = vi.spyOn(properties, 'find');
+    const valueOf = createPropertyValueLookup(properties);
+
+    expect(valueOf({ property_interest: 'Monte Verde' })).toBe(1_500_000);
+    expect(valueOf({ property_interest: 'monte verde ' })).toBe(1_500_000);
+    expect(valueOf({ property_interest: 'Otro', budget: 900_000 })).toBe(900_000);
+    expect(valueOf({ property_interest: 'Otro', budget: 700_000 })).toBe(700_000);
+    expect(find).toHaveBeenCalledTimes(2);
+  });
+});
+
+describe('getCachedForecast', () => {
+  it('should compute once per day and serve later calls from cache', async () => {
+    const from = vi.fn(() => {
+      const chain: any = {};
+      for (const m of ['select', 'in', 'gte', 'order', 'range']) chain[m] = () => chain;
+      chain.then = (resolve: any) => resolve({ data: [], error: null });
+      return chain;
+    });
+    const supabase = { client: { from }, getTenantId: () => 't1' } as any;
+    const cache = new CacheService(null);
+
+    const first = await getCachedForecast(supabase, cache, NOW);
+    const callsAfterFirst = from.mock.calls.length;
+    const second = await getCachedForecast(supabase, cache, NOW);
+
+    expect(second).toEqual(first);
+    expect(callsAfterFirst).toBe(3); // leads activos + properties + histórico
+    expect(from.mock.calls.length).toBe(callsAfterFirst);
+  });
+});
@@ -0,0 +1,172 @@
+import { describe, it, expect, vi, beforeEach } from 'vitest';
+import {
+  splitMetaWebhook,
+  toWebhookBody,
+  consumeInboundEvents,
+  createInboundQueue,
+  MemoryInboundQueue,
+  MEMORY_INBOUND_MAX_ATTEMPTS,
+  getInboundStats,
+  resetInboundStats
+} from '../services/inboundQueueService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// INBOUND QUEUE TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function webhook(value: any) {
+  return { object: 'whatsapp_business_account', entry: [{ changes: [{ field: 'messages', value }] }] };
+}
+
+const METADATA = { phone_number_id: 'pn1' };
+
+describe('splitMetaWebhook', () => {
+  it('should emit one event per message and one for the statuses', () => {
+    const body = webhook({
+      metadata: METADATA,
+      contacts: [{ wa_id: '5215511111111' }],
+      messages: [{ id: 'm1', from: '5215511111111' }, { id: 'm2', from: '5215522222222' }],
+      statuses: [{ id: 's1', status: 'read' }, { id: 's2', status: 'delivered' }]
+    });
+
+    const events = splitMetaWebhook(body, 1000);
+
+    expect(events.map(e => [e.kind, e.key])).toEqual([
+      ['statuses', 'statuses'], ['message', '5215511111111'], ['message', '5215522222222']
+    ]);
+    expect(events[1].value).toEqual({ metadata: METADATA, contacts: [{ wa_id: '5215511111111' }], messages: [{ id: 'm1', from: '5215511111111' }] });
+    expect(events[0].value.statuses).toHaveLength(2);
+    expect(events.every(e => e.receivedAt === 1000)).toBe(true);
+  });
+
+  it('should round-trip a value into the webhook body shape', () => {
+    const value = { metadata: METADATA, messages: [{ id: 'm1' }] };
+    expect(toWebhookBody(value).entry[0].changes[0].value).toBe(value);
+  });
+});
+
+describe('consumeInboundEvents', () => {
+  beforeEach(() => resetInboundStats());
+
+  it('should process messages of one lead in order and statuses in one call', async () => {
+    const order: string[] = [];
+    const onStatuses = vi.fn(async () => {});
+    const handlers = {
+      onMessage: async (value: any) => {
+        const id = value.messages[0].id;
+        // El primero tarda más: si no hubiera cadena por lead, m2 terminaría antes
+        await new Promise(r => setTimeout(r, id === 'm1' ? 20 : 0));
+        order.push(id);
+      },
+      onStatuses
+    };
+    const events = [
+      ...splitMetaWebhook(webhook({ metadata: METADATA, statuses: [{ id: 's1', status: 'sent' }] })),
+      ...splitMetaWebhook(webhook({ metadata: METADATA, messages: [{ id: 'm1', from: '521' }, { id: 'm2', from: '521' }] })),
+      ...splitMetaWebhook(webhook({ metadata: METADATA, statuses: [{ id: 's2', status: 'read' }] }))
+    ];
+
+    await consumeInboundEvents(events, handlers);
+
+    expect(order).toEqual(['m1', 'm2']);
+    expect(onStatuses).toHaveBeenCalledTimes(1);
+    expect(onStatuses).toHaveBeenCalledWith({ metadata: METADATA, statuses: [{ id: 's1', status: 'sent' }, { id: 's2', status: 'read' }] });
+    expect(getInboundStats()).toMatchObject({ consumed: 4, stages: { message: { count: 2 }, statuses: { count: 1 } } });
+  });
+
+  it('should keep lead order across consumers in the same isolate', async () => {
+    const order: string[] = [];
+    const handlers = {
+      onMessage: async (value: any) => {
+        const id = value.messages[0].id;
+        await new Promise(r => setTimeout(r, id === 'first' ? 20 : 0));
+        order.push(id);
+      },
+      onStatuses: async () => {}
+    };
+
+    await Promise.all([
+      consumeInboundEvents(splitMetaWebhook(webhook({ messages: [{ id: 'first', from: '521' }] })), handlers),
+      consumeInboundEvents(splitMetaWebhook(webhook({ messages: [{ id: 'second', from: '521' }] })), handlers)
+    ]);
+
+    expect(order).toEqual(['first', 'second']);
+  });
+
+  it('should return failed events (and the rest of that lead) for retry', async () => {
+    const seen: string[] = [];
+    const handlers = {
+      onMessage: async (value: any) => {
+        const id = value.messages[0].id;
+        seen.push(id);
+        if (id === 'a1') throw new Error('boom');
+      },
+      onStatuses: async () => { throw new Error('db down'); }
+    };
+    const events = [
+      ...splitMetaWebhook(webhook({ metadata: METADATA, statuses: [{ id: 's1', status: 'read' }] })),
+      ...splitMetaWebhook(webhook({ metadata: METADATA, messages: [{ id: 'a1', from: '521' }, { id: 'a2', from: '521' }, { id: 'b1', from: '522' }] }))
+    ];
+
+    const failed = await consumeInboundEvents(events, handlers);
+
+    // a2 no se procesa fuera de orden: se reintenta junto con a1
+    expect(seen.sort()).toEqual(['a1', 'b1']);
+    expect(failed).toHaveLength(3);
+    expect(failed).toEqual(expect.arrayContaining([events[0], events[1], events[2]]));
+    expect(failed).not.toContain(events[3]);
+    expect(getInboundStats().consumed).toBe(1);
+  });
+});
+
+describe('createInboundQueue', () => {
+  beforeEach(() => resetInboundStats());
+
+  it('should process inline when no queue is configured', () => {
+    expect(createInboundQueue({}, async () => {})).toBeNull();
+  });
+
+  it('should send batches to the Cloudflare queue binding', async () => {
+    const sendBatch = vi.fn(async () => {});
+    const queue = createInboundQueue({ META_INBOUND_QUEUE: { sendBatch } as any, META_ACK_FIRST: 'true' }, async () => {});
+
+    await queue!.send(splitMetaWebhook(webhook({ messages: [{ id: 'm1', from: '521' }] }), 5));
+
+    expect(sendBatch).toHaveBeenCalledWith([{ body: expect.objectContaining({ kind: 'message', key: '521', receivedAt: 5 }) }]);
+    expect(getInboundStats().enqueued).toBe(1);
+  });
+
+  it('should hand the in-memory drain to waitUntil', async () => {
+    const consume = vi.fn(async () => {});
+    const waitUntil = vi.fn();
+    const queue = createInboundQueue({ META_ACK_FIRST: 'true' }, consume, waitUntil);
+
+    expect(queue).toBeInstanceOf(MemoryInboundQueue);
+    await queue!.send(splitMetaWebhook(webhook({ messages: [{ id: 'm1', from: '521' }] })));
+
+    expect(consume).toHaveBeenCalledTimes(1);
+    expect(waitUntil).toHaveBeenCalledTimes(1);
+  });
+
+  it('should retry failed events in-process a bounded number of times', async () => {
+    const events = splitMetaWebhook(webhook({ messages: [{ id: 'm1', from: '521' }, { id: 'm2', from: '522' }] }));
+    const consume = vi.fn().mockResolvedValue([events[1]]);
+    const errorSpy = vi.spyOn(console, 'error').mockImplementation(() => {});
+
+    await new MemoryInboundQueue(consume, undefined, 0).send(events);
+
+    expect(consume).toHaveBeenCalledTimes(MEMORY_INBOUND_MAX_ATTEMPTS);
+    expect(consume).toHaveBeenNthCalledWith(2, [events[1]]);
+    expect(errorSpy).toHaveBeenCalledWith(expect.stringContaining('descartados'));
+    errorSpy.mockRestore();
+  });
+
+  it('should stop retrying once the failed events succeed', async () => {
+    const events = splitMetaWebhook(webhook({ messages: [{ id: 'm1', from: '521' }] }));
+    const consume = vi.fn().mockResolvedValueOnce(events).mockResolvedValueOnce([]);
+
+    await new MemoryInboundQueue(consume, undefined, 0).send(events);
+
+    expect(consume).toHaveBeenCalledTimes(2);
+  });
+});
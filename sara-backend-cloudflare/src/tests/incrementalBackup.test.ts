@@ -0,0 +1,198 @@
+import { describe, it, expect, vi } from 'vitest';
+import { IncrementalBackupService } from '../services/incrementalBackupService';
+import { deleteR2Keys } from '../services/backupStreamService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// INCREMENTAL BACKUP TESTS (manifest + deltas + compactación + restore)
+// ═══════════════════════════════════════════════════════════════════════════
+
+function toBytes(value: any): Uint8Array {
+  return typeof value === 'string' ? new TextEncoder().encode(value) : value;
+}
+
+/** R2 en memoria: put/get/delete (string o array) */
+function createMemoryR2() {
+  const objects = new Map<string, Uint8Array>();
+  const r2 = {
+    objects,
+    put: vi.fn(async (key: string, value: any) => { objects.set(key, toBytes(value)); return {}; }),
+    get: vi.fn(async (key: string) => {
+      const bytes = objects.get(key);
+      if (!bytes) return null;
+      return {
+        body: new Blob([bytes]).stream(),
+        json: async () => JSON.parse(new TextDecoder().decode(bytes))
+      };
+    }),
+    delete: vi.fn(async (keys: string | string[]) => {
+      for (const k of Array.isArray(keys) ? keys : [keys]) objects.delete(k);
+    })
+  };
+  return r2;
+}
+
+/** Tabla en memoria con filtros de keyset (eq/gt/lte/limit); backup_tombstones aparte */
+function createTableSupabase(rows: any[], tombstones: any[] = []) {
+  const upsert = vi.fn().mockResolvedValue({ error: null });
+  const deleteIn = vi.fn().mockResolvedValue({ error: null });
+  const from = vi.fn((table: string) => {
+    const source = table === 'backup_tombstones' ? tombstones : rows;
+    const filters: Array<(r: any) => boolean> = [];
+    let limit = Infinity;
+    const chain: any = {
+      select: () => chain,
+      eq: (col: string, v: string) => { filters.push(r => r[col] === v); return chain; },
+      gt: (col: string, v: string) => { filters.push(r => r[col] > v); return chain; },
+      lte: (col: string, v: string) => { filters.push(r => r[col] <= v); return chain; },
+      order: () => chain,
+      limit: (n: number) => { limit = n; return chain; },
+      upsert,
+      delete: () => ({ in: deleteIn }),
+      then: (resolve: any) => resolve({
+        data: source.filter(r => filters.every(f => f(r))).sort((a, b) => a.id.localeCompare(b.id)).slice(0, limit),
+        error: null
+      })
+    };
+    return chain;
+  });
+  return { supabase: { client: { from }, getTenantId: () => 't1' } as any, upsert, deleteIn };
+}
+
+const DAY1 = new Date('2026-03-01T01:00:00Z');
+const DAY2 = new Date('2026-03-02T01:00:00Z');
+const DAY3 = new Date('2026-03-03T01:00:00Z');
+
+describe('IncrementalBackupService', () => {
+  it('should take a snapshot first and then only export changed rows', async () => {
+    const rows = [
+      { id: 'a', name: 'Ana', updated_at: '2026-02-20T00:00:00Z' },
+      { id: 'b', name: 'Beto', updated_at: '2026-02-25T00:00:00Z' }
+    ];
+    const { supabase } = createTableSupabase(rows);
+    const r2 = createMemoryR2();
+    const backup = new IncrementalBackupService(supabase, r2 as any, { pageSize: 1 });
+
+    const first = await backup.backupTable('leads', { now: DAY1 });
+    expect(first).toMatchObject({ mode: 'snapshot', rows: 2 });
+
+    rows[1] = { id: 'b', name: 'Beto G', updated_at: '2026-03-01T12:00:00Z' };
+    const second = await backup.backupTable('leads', { now: DAY2 });
+    expect(second).toMatchObject({ mode: 'delta', rows: 1 });
+
+    const manifest = await backup.getManifest('leads');
+    expect(manifest.watermark).toBe(DAY2.toISOString());
+    expect(manifest.segments).toHaveLength(1);
+    expect(manifest.snapshot!.key).toContain('backups/incremental/t1/leads/snapshot-');
+  });
+
+  it('should re-read a margin before the watermark to catch late commits', async () => {
+    const rows: any[] = [{ id: 'a', name: 'Ana', updated_at: '2026-02-20T00:00:00Z' }];
+    const { supabase } = createTableSupabase(rows);
+    const r2 = createMemoryR2();
+    const backup = new IncrementalBackupService(supabase, r2 as any);
+
+    await backup.backupTable('leads', { now: DAY1 });
+    // Transacción iniciada antes del corte (updated_at = now() de la base) pero confirmada después
+    rows.push({ id: 'late', name: 'Tardío', updated_at: '2026-03-01T00:58:00Z' });
+    const result = await backup.backupTable('leads', { now: DAY2 });
+
+    expect(result).toMatchObject({ mode: 'delta', rows: 1 });
+  });
+
+  it('should not keep empty delta segments', async () => {
+    const { supabase } = createTableSupabase([{ id: 'a', updated_at: '2026-02-20T00:00:00Z' }]);
+    const r2 = createMemoryR2();
+    const backup = new IncrementalBackupService(supabase, r2 as any);
+
+    await backup.backupTable('leads', { now: DAY1 });
+    const result = await backup.backupTable('leads', { now: DAY2 });
+
+    expect(result.mode).toBe('noop');
+    expect((await backup.getManifest('leads')).segments).toEqual([]);
+    expect([...r2.objects.keys()].some(k => k.includes('/delta-'))).toBe(false);
+  });
+
+  it('should compact snapshot + deltas and batch-delete the old files', async () => {
+    const rows = [
+      { id: 'a', name: 'Ana', updated_at: '2026-02-20T00:00:00Z' },
+      { id: 'b', name: 'Beto', updated_at: '2026-02-20T00:00:00Z' }
+    ];
+    const { supabase } = createTableSupabase(rows);
+    const r2 = createMemoryR2();
+    const backup = new IncrementalBackupService(supabase, r2 as any, { compactAfter: 2 });
+
+    await backup.backupTable('leads', { now: DAY1 });
+    rows[0] = { id: 'a', name: 'Ana v2', updated_at: '2026-03-01T10:00:00Z' };
+    await backup.backupTable('leads', { now: DAY2 });
+    rows.push({ id: 'c', name: 'Caro', updated_at: '2026-03-02T10:00:00Z' });
+    const result = await backup.backupTable('leads', { now: DAY3 });
+
+    expect(result.compacted).toBe(true);
+    expect(result.deletedKeys).toBe(3); // snapshot viejo + 2 deltas
+    const deleteBatch = r2.delete.mock.calls.find(c => Array.isArray(c[0]) && c[0].length === 3);
+    expect(deleteBatch).toBeDefined();
+
+    const manifest = await backup.getManifest('leads');
+    expect(manifest.segments).toEqual([]);
+    expect(manifest.snapshot!.rows).toBe(3);
+
+    const restored = await backup.restoreTable('leads');
+    expect(restored).toMatchObject({ files: 1, rows: 3, upserted: 0, dryRun: true });
+  });
+
+  it('restore should upsert snapshot then deltas in order', async () => {
+    const rows = [{ id: 'a', name: 'Ana', updated_at: '2026-02-20T00:00:00Z' }];
+    const { supabase, upsert } = createTableSupabase(rows);
+    const r2 = createMemoryR2();
+    const backup = new IncrementalBackupService(supabase, r2 as any);
+
+    await backup.backupTable('leads', { now: DAY1 });
+    rows[0] = { id: 'a', name: 'Ana v2', updated_at: '2026-03-01T10:00:00Z' };
+    await backup.backupTable('leads', { now: DAY2 });
+
+    const result = await backup.restoreTable('leads', { dryRun: false });
+
+    expect(result).toMatchObject({ files: 2, rows: 2, upserted: 2, dryRun: false });
+    expect(upsert.mock.calls.map(c => c[0][0].name)).toEqual(['Ana', 'Ana v2']);
+    expect(upsert.mock.calls[0][1]).toEqual({ onConflict: 'id' });
+  });
+
+  it('should export hard deletes as tombstones that compaction and restore apply', async () => {
+    const rows = [
+      { id: 'a', name: 'Ana', updated_at: '2026-02-20T00:00:00Z' },
+      { id: 'b', name: 'Beto', updated_at: '2026-02-20T00:00:00Z' }
+    ];
+    const tombstones: any[] = [];
+    const { supabase, deleteIn } = createTableSupabase(rows, tombstones);
+    const r2 = createMemoryR2();
+    const backup = new IncrementalBackupService(supabase, r2 as any, { compactAfter: 2 });
+
+    await backup.backupTable('leads', { now: DAY1 });
+    // DELETE del lead: sale de la tabla y deja tombstone
+    rows.splice(1, 1);
+    tombstones.push({ table_name: 'leads', id: 'b', deleted_at: '2026-03-01T10:00:00Z' });
+    tombstones.push({ table_name: 'appointments', id: 'x', deleted_at: '2026-03-01T10:00:00Z' });
+    const delta = await backup.backupTable('leads', { now: DAY2 });
+    expect(delta).toMatchObject({ mode: 'delta', rows: 1 });
+
+    const restored = await backup.restoreTable('leads', { dryRun: false });
+    expect(restored).toMatchObject({ files: 2, rows: 3, upserted: 2, deleted: 1 });
+    expect(deleteIn).toHaveBeenCalledWith('id', ['b']);
+
+    rows.push({ id: 'c', name: 'Caro', updated_at: '2026-03-02T10:00:00Z' });
+    await backup.backupTable('leads', { now: DAY3 });
+    const manifest = await backup.getManifest('leads');
+    expect(manifest.segments).toEqual([]);
+    expect(manifest.snapshot!.rows).toBe(2); // a + c, sin b
+  });
+});
+
+describe('deleteR2Keys', () => {
+  it('should delete in batches of 1000 keys', async () => {
+    const r2 = { delete: vi.fn().mockResolvedValue(undefined) };
+    const keys = Array.from({ length: 2500 }, (_, i) => `k${i}`);
+
+    expect(await deleteR2Keys(r2 as any, keys)).toBe(2500);
+    expect(r2.delete.mock.calls.map(c => c[0].length)).toEqual([1000, 1000, 500]);
+  });
+});
@@ -0,0 +1,257 @@
+import { describe, it, expect, vi } from 'vitest';
+import { MessageQueueService } from '../services/messageQueueService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// MESSAGE QUEUE v2 TESTS (enqueueMany en lote + drainer por prioridad)
+// ═══════════════════════════════════════════════════════════════════════════
+
+const hace1h = () => new Date(Date.now() - 60 * 60 * 1000).toISOString();
+const hace2d = () => new Date(Date.now() - 48 * 60 * 60 * 1000).toISOString();
+
+function member(id: string, lastInteraction: string | null) {
+  return {
+    id,
+    name: `Vendedor ${id}`,
+    phone: `52156100000${id.slice(-2)}`,
+    notes: lastInteraction ? { last_sara_interaction: lastInteraction } : {}
+  };
+}
+
+function createMockSupabase(members: any[], queued: any[] = [], rpcError: any = null) {
+  const calls: Record<string, any[]> = { teamMembersIn: [], queueInsert: [], auditInsert: [], upsert: [], claims: [] };
+  // claim_message_queue: cada fila se entrega a un solo claim (como SKIP LOCKED)
+  let unclaimed = [...queued];
+  const rpc = vi.fn(async (fn: string, args: any) => {
+    if (fn !== 'claim_message_queue') throw new Error(`unexpected rpc ${fn}`);
+    calls.claims.push(args);
+    if (rpcError) return { data: null, error: rpcError };
+    const claimed = unclaimed.slice(0, args.p_limit).map(r => ({ ...r, locked_by: args.p_worker }));
+    unclaimed = unclaimed.slice(args.p_limit);
+    return { data: claimed, error: null };
+  });
+
+  const from = vi.fn((table: string) => {
+    if (table === 'team_members') {
+      return {
+        select: () => ({
+          in: vi.fn(async (_col: string, ids: string[]) => {
+            calls.teamMembersIn.push(ids);
+            return { data: members.filter(m => ids.includes(m.id)), error: null };
+          })
+        }),
+        update: () => ({ eq: vi.fn().mockResolvedValue({ error: null }) })
+      };
+    }
+    if (table === 'message_queue') {
+      return {
+        insert: (rows: any[]) => {
+          calls.queueInsert.push(rows);
+          return { select: vi.fn().mockResolvedValue({ data: rows.map((_, i) => ({ id: `mq-${i}` })), error: null }) };
+        },
+        upsert: vi.fn(async (rows: any[], opts: any) => {
+          calls.upsert.push({ rows, opts });
+          return { error: null };
+        })
+      };
+    }
+    if (table === 'message_audit_log') {
+      return { insert: vi.fn(async (rows: any) => { calls.auditInsert.push(rows); return { error: null }; }) };
+    }
+    throw new Error(`unexpected table ${table}`);
+  });
+
+  return { supabase: { client: { from, rpc } } as any, calls };
+}
+
+function createMockMeta(fail: (job: any) => string | null = () => null) {
+  return {
+    sendMany: vi.fn(async (jobs: any[]) => jobs.map((job, index) => {
+      const error = fail(job);
+      return error ? { index, to: job.to, ok: false, error } : { index, to: job.to, ok: true, result: {} };
+    }))
+  };
+}
+
+describe('MessageQueueService.enqueueMany', () => {
+  it('should load every recipient window state in a single query', async () => {
+    const { supabase, calls } = createMockSupabase([member('tm01', hace1h()), member('tm02', hace2d())]);
+    const meta = createMockMeta();
+    const mq = new MessageQueueService(supabase, meta as any);
+
+    await mq.enqueueMany([
+      { teamMemberId: 'tm01', messageType: 'briefing', messageContent: 'Briefing 1' },
+      { teamMemberId: 'tm02', messageType: 'briefing', messageContent: 'Briefing 2' },
+      { teamMemberId: 'tm01', messageType: 'alerta', messageContent: 'Alerta 1' }
+    ]);
+
+    expect(calls.teamMembersIn).toHaveLength(1);
+    expect(calls.teamMembersIn[0].sort()).toEqual(['tm01', 'tm02']);
+  });
+
+  it('should send direct when the window is open and one template per closed recipient', async () => {
+    const { supabase, calls } = createMockSupabase([member('tm01', hace1h()), member('tm02', hace2d())]);
+    const meta = createMockMeta();
+    const mq = new MessageQueueService(supabase, meta as any);
+
+    const results = await mq.enqueueMany([
+      { teamMemberId: 'tm01', messageType: 'briefing', messageContent: 'Briefing 1' },
+      { teamMemberId: 'tm02', messageType: 'briefing', messageContent: 'Briefing 2' },
+      { teamMemberId: 'tm02', messageType: 'recap', messageContent: 'Recap 2' }
+    ]);
+
+    expect(results.map(r => r.method)).toEqual(['direct', 'template', 'template']);
+    const templateJobs = meta.sendMany.mock.calls.flatMap(c => c[0]).filter((j: any) => j.template);
+    expect(templateJobs).toHaveLength(1);
+
+    // Un solo insert multi-row con los dos mensajes esperando respuesta
+    expect(calls.queueInsert).toHaveLength(1);
+    expect(calls.queueInsert[0].map((r: any) => r.status)).toEqual(['template_sent', 'template_sent']);
+    expect(results[1].messageId).toBe('mq-0');
+    expect(calls.auditInsert).toHaveLength(1);
+  });
+
+  it('should fall back to a template when the direct send fails', async () => {
+    const { supabase } = createMockSupabase([member('tm01', hace1h())]);
+    const meta = createMockMeta(job => (job.text ? 'Meta API Error: 131047' : null));
+    const mq = new MessageQueueService(supabase, meta as any);
+
+    const [result] = await mq.enqueueMany([{ teamMemberId: 'tm01', messageType: 'alerta', messageContent: 'Alerta' }]);
+
+    expect(result.method).toBe('template');
+    expect(meta.sendMany).toHaveBeenCalledTimes(2);
+  });
+
+  it('should queue for the drainer when the template fails too', async () => {
+    const { supabase, calls } = createMockSupabase([member('tm02', hace2d())]);
+    const meta = createMockMeta(() => 'Meta API Error: 503');
+    const mq = new MessageQueueService(supabase, meta as any);
+
+    const [result] = await mq.enqueueMany([{ teamMemberId: 'tm02', messageType: 'briefing', messageContent: 'B' }]);
+
+    expect(result.method).toBe('queued');
+    const row = calls.queueInsert[0][0];
+    expect(row).toMatchObject({ status: 'queued', priority: 1, last_error: 'Meta API Error: 503' });
+    expect(row.next_retry_at).toBeDefined();
+  });
+
+  it('should report unknown team members as failed without sending', async () => {
+    const { supabase } = createMockSupabase([]);
+    const meta = createMockMeta();
+    const mq = new MessageQueueService(supabase, meta as any);
+
+    const [result] = await mq.enqueueMany([{ teamMemberId: 'nope', messageType: 'briefing', messageContent: 'B' }]);
+
+    expect(result).toMatchObject({ success: false, method: 'failed' });
+    expect(meta.sendMany).not.toHaveBeenCalled();
+  });
+});
+
+describe('MessageQueueService.drainQueue', () => {
+  const queuedRow = (id: string, teamMemberId: string, overrides: Record<string, any> = {}) => ({
+    id,
+    team_member_id: teamMemberId,
+    team_member_phone: `52156100000${teamMemberId.slice(-2)}`,
+    team_member_name: 'Vendedor',
+    message_type: 'briefing',
+    message_content: `contenido ${id}`,
+    status: 'queued',
+    priority: 1,
+    retry_count: 0,
+    max_retries: 3,
+    next_retry_at: null,
+    last_error: null,
+    created_at: hace1h(),
+    template_sent_at: null,
+    delivered_at: null,
+    expires_at: new Date(Date.now() + 3600_000).toISOString(),
+    ...overrides
+  });
+
+  it('should write every transition in a single upsert', async () => {
+    const { supabase, calls } = createMockSupabase(
+      [member('tm01', hace1h()), member('tm02', hace2d())],
+      [
+        queuedRow('q1', 'tm01'),
+        queuedRow('q2', 'tm02'),
+        queuedRow('q3', 'tm02', { message_type: 'recap', priority: 2 }),
+        queuedRow('q4', 'tm02', { expires_at: hace1h() })
+      ]
+    );
+    const meta = createMockMeta();
+    const mq = new MessageQueueService(supabase, meta as any);
+
+    const result = await mq.drainQueue();
+
+    expect(meta.sendMany).toHaveBeenCalledTimes(1);
+    expect(meta.sendMany.mock.calls[0][0]).toHaveLength(2); // 1 directo + 1 template para tm02
+    expect(calls.upsert).toHaveLength(1);
+    expect(calls.upsert[0].opts).toEqual({ onConflict: 'id' });
+    const byId = Object.fromEntries(calls.upsert[0].rows.map((r: any) => [r.id, r]));
+    expect(byId.q1.status).toBe('delivered');
+    expect(byId.q2.status).toBe('template_sent');
+    expect(byId.q3.status).toBe('template_sent');
+    expect(byId.q4.status).toBe('expired');
+    expect(byId.q1).toMatchObject({ locked_by: null, locked_until: null });
+    expect(result).toMatchObject({ processed: 3, delivered: 1, templateSent: 2, expired: 1 });
+  });
+
+  it('should never send the same row from overlapping drains', async () => {
+    const { supabase, calls } = createMockSupabase(
+      [member('tm01', hace1h()), member('tm02', hace1h())],
+      [queuedRow('q1', 'tm01'), queuedRow('q2', 'tm02')]
+    );
+    const meta = createMockMeta();
+
+    const [a, b] = await Promise.all([
+      new MessageQueueService(supabase, meta as any).drainQueue(),
+      new MessageQueueService(supabase, meta as any).drainQueue()
+    ]);
+
+    const sentTo = meta.sendMany.mock.calls.flatMap(c => c[0].map((j: any) => j.to));
+    expect(sentTo.sort()).toEqual(['5215610000001', '5215610000002']);
+    expect(a.processed + b.processed).toBe(2);
+    expect(calls.claims[0]).toMatchObject({ p_limit: 25, p_lease_seconds: 180 });
+  });
+
+  it('should skip the drain when the claim RPC is missing', async () => {
+    const { supabase } = createMockSupabase(
+      [member('tm01', hace1h())],
+      [queuedRow('q1', 'tm01')],
+      { code: 'PGRST202', message: 'function not found' }
+    );
+    const meta = createMockMeta();
+
+    const result = await new MessageQueueService(supabase, meta as any).drainQueue();
+
+    expect(result.processed).toBe(0);
+    expect(meta.sendMany).not.toHaveBeenCalled();
+  });
+
+  it('should back off on failure and give up after max_retries', async () => {
+    const { supabase, calls } = createMockSupabase(
+      [member('tm01', hace2d()), member('tm02', hace2d())],
+      [queuedRow('q1', 'tm01'), queuedRow('q2', 'tm02', { retry_count: 2 })]
+    );
+    const meta = createMockMeta(() => 'Meta API Error: 503');
+    const mq = new MessageQueueService(supabase, meta as any);
+
+    const result = await mq.drainQueue();
+
+    const byId = Object.fromEntries(calls.upsert[0].rows.map((r: any) => [r.id, r]));
+    expect(byId.q1).toMatchObject({ status: 'queued', retry_count: 1 });
+    expect(new Date(byId.q1.next_retry_at).getTime()).toBeGreaterThan(Date.now());
+    expect(byId.q2).toMatchObject({ status: 'failed', retry_count: 3 });
+    expect(result).toMatchObject({ rescheduled: 1, failed: 1 });
+  });
+
+  it('should do nothing in legacy mode', async () => {
+    const { supabase } = createMockSupabase([], [queuedRow('q1', 'tm01')]);
+    const meta = createMockMeta();
+    const mq = new MessageQueueService(supabase, meta as any, false);
+
+    const result = await mq.drainQueue();
+
+    expect(result.processed).toBe(0);
+    expect(meta.sendMany).not.toHaveBeenCalled();
+  });
+});
@@ -0,0 +1,143 @@
+import { describe, it, expect, vi, afterEach } from 'vitest';
+import { createMessageTrackingBuffer } from '../services/messageTrackingService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// MESSAGE TRACKING BUFFER TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function createMockSupabase() {
+  const insertSpy = vi.fn().mockResolvedValue({ error: null });
+  const inSpy = vi.fn().mockResolvedValue({ error: null });
+  const updateSpy = vi.fn(() => ({ in: inSpy }));
+  const supabase = {
+    client: {
+      from: vi.fn(() => ({ insert: insertSpy, update: updateSpy }))
+    }
+  } as any;
+  return { supabase, insertSpy, updateSpy, inSpy };
+}
+
+const sent = (id: string) => ({
+  messageId: id,
+  recipientPhone: '5215610016226',
+  recipientType: 'lead' as const,
+  messageType: 'text' as const,
+  categoria: 'respuesta_sara',
+  contenido: 'Hola'
+});
+
+describe('MessageTrackingBuffer', () => {
+  afterEach(() => {
+    vi.useRealTimers();
+  });
+
+  it('should not write anything on addSent (no latency on the send path)', () => {
+    const { supabase, insertSpy } = createMockSupabase();
+    const buffer = createMessageTrackingBuffer(supabase);
+    buffer.addSent(sent('wamid.1'));
+    expect(insertSpy).not.toHaveBeenCalled();
+    expect(buffer.getPendingCount()).toBe(1);
+  });
+
+  it('should flush sent rows as one multi-row insert with the same columns', async () => {
+    const { supabase, insertSpy } = createMockSupabase();
+    const buffer = createMessageTrackingBuffer(supabase);
+    buffer.addSent(sent('wamid.1'));
+    buffer.addSent(sent('wamid.2'));
+    buffer.addSent(sent('wamid.3'));
+    await buffer.flush();
+
+    expect(insertSpy).toHaveBeenCalledTimes(1);
+    const rows = insertSpy.mock.calls[0][0];
+    expect(rows).toHaveLength(3);
+    expect(rows[0]).toMatchObject({
+      message_id: 'wamid.1',
+      recipient_phone: '5215610016226',
+      recipient_type: 'lead',
+      message_type: 'text',
+      categoria: 'respuesta_sara',
+      contenido: 'Hola',
+      status: 'sent'
+    });
+    expect(rows[0].sent_at).toBeDefined();
+    expect(buffer.getStats()).toMatchObject({ pending: 0, flushes: 1, rowsWritten: 3 });
+  });
+
+  it('should group status updates by status into IN (...) updates', async () => {
+    const { supabase, updateSpy, inSpy } = createMockSupabase();
+    const buffer = createMessageTrackingBuffer(supabase);
+    buffer.addStatus('wamid.1', 'delivered');
+    buffer.addStatus('wamid.2', 'delivered');
+    buffer.addStatus('wamid.3', 'read');
+    buffer.addStatus('wamid.4', 'failed', 'Undeliverable');
+    await buffer.flush();
+
+    expect(updateSpy).toHaveBeenCalledTimes(3);
+    expect(inSpy).toHaveBeenCalledWith('message_id', ['wamid.1', 'wamid.2']);
+    const failedUpdate = (updateSpy.mock.calls as any[]).find(c => c[0].status === 'failed')[0];
+    expect(failedUpdate.error_message).toBe('Undeliverable');
+    expect(failedUpdate.failed_at).toBeDefined();
+  });
+
+  it('should keep only the highest-ranked status per message before grouping', async () => {
+    const { supabase, updateSpy, inSpy } = createMockSupabase();
+    const buffer = createMessageTrackingBuffer(supabase);
+    buffer.addStatus('wamid.1', 'read');
+    buffer.addStatus('wamid.1', 'delivered'); // llegó tarde: no debe pisar read
+    buffer.addStatus('wamid.2', 'delivered');
+    await buffer.flush();
+
+    expect(updateSpy).toHaveBeenCalledTimes(2);
+    const readCall = (updateSpy.mock.calls as any[]).findIndex(c => c[0].status === 'read');
+    expect(inSpy.mock.calls[readCall]).toEqual(['message_id', ['wamid.1']]);
+    const deliveredCall = (updateSpy.mock.calls as any[]).findIndex(c => c[0].status === 'delivered');
+    expect(inSpy.mock.calls[deliveredCall]).toEqual(['message_id', ['wamid.2']]);
+  });
+
+  it('should flush through waitUntil when the size cap is reached', async () => {
+    const { supabase, insertSpy } = createMockSupabase();
+    const waitUntil = vi.fn();
+    const buffer = createMessageTrackingBuffer(supabase, { waitUntil, maxSize: 2 });
+    buffer.addSent(sent('wamid.1'));
+    buffer.addSent(sent('wamid.2'));
+
+    expect(waitUntil).toHaveBeenCalledTimes(1);
+    await waitUntil.mock.calls[0][0];
+    expect(insertSpy).toHaveBeenCalledTimes(1);
+    expect(insertSpy.mock.calls[0][0]).toHaveLength(2);
+  });
+
+  it('should flush after maxAgeMs even below the size cap', async () => {
+    vi.useFakeTimers();
+    const { supabase, insertSpy } = createMockSupabase();
+    const waitUntil = vi.fn();
+    const buffer = createMessageTrackingBuffer(supabase, { waitUntil, maxAgeMs: 1000 });
+    buffer.addSent(sent('wamid.1'));
+
+    await vi.advanceTimersByTimeAsync(999);
+    expect(insertSpy).not.toHaveBeenCalled();
+    await vi.advanceTimersByTimeAsync(1);
+    await waitUntil.mock.calls[0][0];
+    expect(insertSpy).toHaveBeenCalledTimes(1);
+  });
+
+  it('should write sent rows before status updates and report the flushed count', async () => {
+    const order: string[] = [];
+    const supabase = {
+      client: {
+        from: () => ({
+          insert: async () => { order.push('insert'); return { error: null }; },
+          update: () => ({ in: async () => { order.push('update'); return { error: null }; } })
+        })
+      }
+    } as any;
+    const onSentFlushed = vi.fn().mockResolvedValue(undefined);
+    const buffer = createMessageTrackingBuffer(supabase, { onSentFlushed });
+    buffer.addStatus('wamid.1', 'delivered');
+    buffer.addSent(sent('wamid.1'));
+    await buffer.flush();
+
+    expect(order).toEqual(['insert', 'update']);
+    expect(onSentFlushed).toHaveBeenCalledWith(1);
+  });
+});
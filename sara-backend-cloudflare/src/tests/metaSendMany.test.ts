@@ -0,0 +1,194 @@
+import { describe, it, expect, vi, beforeEach, afterEach } from 'vitest';
+import { MetaWhatsAppService } from '../services/meta-whatsapp';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// META sendMany TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function okResponse(id: string): Response {
+  return new Response(JSON.stringify({ messages: [{ id }] }), { status: 200 });
+}
+
+describe('MetaWhatsAppService.sendMany', () => {
+  const originalFetch = globalThis.fetch;
+  let sentBodies: any[];
+
+  beforeEach(() => {
+    sentBodies = [];
+    let n = 0;
+    globalThis.fetch = vi.fn(async (_url: any, init?: any) => {
+      const body = JSON.parse(init.body);
+      sentBodies.push(body);
+      // Respuestas con latencia variable para forzar intercalado entre destinatarios
+      await new Promise(r => setTimeout(r, body.to.endsWith('1') ? 5 : 1));
+      return okResponse(`wamid.${++n}`);
+    }) as any;
+  });
+
+  afterEach(() => {
+    globalThis.fetch = originalFetch;
+  });
+
+  it('should return one result per job in input order', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    const results = await meta.sendMany([
+      { to: '5610000001', text: 'hola 1' },
+      { to: '5610000002', template: { name: 'promo_desarrollo', languageCode: 'es_MX', components: [] } },
+      { to: '5610000003', text: 'hola 3' }
+    ]);
+
+    expect(results).toHaveLength(3);
+    expect(results.map(r => r.index)).toEqual([0, 1, 2]);
+    expect(results.every(r => r.ok)).toBe(true);
+    expect(sentBodies.find(b => b.type === 'template')?.template.name).toBe('promo_desarrollo');
+  });
+
+  it('should preserve per-recipient order under concurrency', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    await meta.sendMany([
+      { to: '5610000001', text: 'A1' },
+      { to: '5610000002', text: 'B1' },
+      { to: '5610000001', text: 'A2' },
+      { to: '5610000002', text: 'B2' },
+      { to: '5610000001', text: 'A3' }
+    ], { concurrency: 2 });
+
+    const forA = sentBodies.filter(b => b.to === '5215610000001').map(b => b.text.body);
+    const forB = sentBodies.filter(b => b.to === '5215610000002').map(b => b.text.body);
+    expect(forA).toEqual(['A1', 'A2', 'A3']);
+    expect(forB).toEqual(['B1', 'B2']);
+  });
+
+  it('should keep chunks of long messages in order', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    const long = 'a'.repeat(3000) + '\n' + 'b'.repeat(3000);
+    await meta.sendMany([{ to: '5610000001', text: long }, { to: '5610000001', text: 'después' }]);
+
+    const bodies = sentBodies.map(b => b.text.body);
+    expect(bodies).toHaveLength(3);
+    expect(bodies[0].startsWith('a')).toBe(true);
+    expect(bodies[1].startsWith('b')).toBe(true);
+    expect(bodies[2]).toBe('después');
+  });
+
+  it('should report per-item errors without throwing', async () => {
+    globalThis.fetch = vi.fn(async (_url: any, init?: any) => {
+      const body = JSON.parse(init.body);
+      if (body.to === '5215610000002') {
+        return new Response(JSON.stringify({ error: { code: 131026, message: 'Undeliverable' } }), { status: 400 });
+      }
+      return okResponse('wamid.ok');
+    }) as any;
+
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    const results = await meta.sendMany([
+      { to: '5610000001', text: 'ok' },
+      { to: '5610000002', text: 'falla' },
+      { to: '5610000003' } as any
+    ]);
+
+    expect(results[0].ok).toBe(true);
+    expect(results[1].ok).toBe(false);
+    expect(results[1].error).toBe('Undeliverable');
+    expect(results[2].ok).toBe(false);
+  });
+
+  it('should deliver tracking in a single batch callback', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    const single = vi.fn().mockResolvedValue(undefined);
+    const batch = vi.fn().mockResolvedValue(undefined);
+    meta.setTrackingCallback(single);
+    meta.setBatchTrackingCallback(batch);
+
+    await meta.sendMany([
+      { to: '5610000001', text: 'uno' },
+      { to: '5610000002', text: 'dos' },
+      { to: '5610000003', text: 'tres' }
+    ]);
+
+    expect(single).not.toHaveBeenCalled();
+    expect(batch).toHaveBeenCalledTimes(1);
+    expect(batch.mock.calls[0][0]).toHaveLength(3);
+  });
+
+  it('should not pull concurrent sends outside the batch into it', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    const single = vi.fn().mockResolvedValue(undefined);
+    const batch = vi.fn().mockResolvedValue(undefined);
+    meta.setTrackingCallback(single);
+    meta.setBatchTrackingCallback(batch);
+
+    await Promise.all([
+      meta.sendMany([{ to: '5610000001', text: 'lote 1' }, { to: '5610000002', text: 'lote 2' }]),
+      meta.sendWhatsAppMessage('5610000003', 'respuesta a otro lead')
+    ]);
+
+    expect(single).toHaveBeenCalledTimes(1);
+    expect(single.mock.calls[0][0].recipientPhone).toBe('5215610000003');
+    expect(batch.mock.calls[0][0]).toHaveLength(2);
+  });
+
+  it('should fall back to per-item tracking after the batch when no batch callback is set', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    const single = vi.fn().mockResolvedValue(undefined);
+    meta.setTrackingCallback(single);
+
+    await meta.sendMany([{ to: '5610000001', text: 'uno' }, { to: '5610000002', text: 'dos' }]);
+
+    expect(single).toHaveBeenCalledTimes(2);
+  });
+
+  it('should batch failed-message callbacks when retries are exhausted', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    (meta as any).fetchWithRetry = vi.fn().mockRejectedValue(new Error('Meta API Error: 503 Service Unavailable'));
+    const single = vi.fn().mockResolvedValue(undefined);
+    const batch = vi.fn().mockResolvedValue(undefined);
+    meta.setFailedMessageCallback(single);
+    meta.setBatchFailedMessageCallback(batch);
+
+    const results = await meta.sendMany([
+      { to: '5610000001', text: 'uno' },
+      { to: '5610000002', template: { name: 'promo_desarrollo' } }
+    ]);
+
+    expect(results.every(r => !r.ok)).toBe(true);
+    expect(single).not.toHaveBeenCalled();
+    expect(batch).toHaveBeenCalledTimes(1);
+    expect(batch.mock.calls[0][0].map((f: any) => f.messageType).sort()).toEqual(['template', 'text']);
+  });
+
+  it('should scope requeue: false to its own batch', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    (meta as any).fetchWithRetry = vi.fn().mockRejectedValue(new Error('Meta API Error: 503 Service Unavailable'));
+    const failed = vi.fn().mockResolvedValue(undefined);
+    meta.setFailedMessageCallback(failed);
+
+    await Promise.all([
+      meta.sendMany([{ to: '5610000001', text: 'reintento' }], { requeue: false }),
+      meta.sendWhatsAppMessage('5610000002', 'otro envío').catch(() => {})
+    ]);
+
+    expect(failed).toHaveBeenCalledTimes(1);
+    expect(failed.mock.calls[0][0].recipientPhone).toBe('5215610000002');
+  });
+
+  it('should serialize the global KV rate limit check across concurrent sends', async () => {
+    const meta = new MetaWhatsAppService('phone_id', 'token');
+    let counter = 0;
+    const kv = {
+      get: vi.fn(async () => { await new Promise(r => setTimeout(r, 1)); return String(counter); }),
+      put: vi.fn(async (_k: string, v: string) => { counter = parseInt(v, 10); })
+    };
+    meta.setKVNamespace(kv as any);
+
+    await meta.sendMany([
+      { to: '5610000001', text: '1' },
+      { to: '5610000002', text: '2' },
+      { to: '5610000003', text: '3' },
+      { to: '5610000004', text: '4' }
+    ], { concurrency: 4 });
+
+    // Sin serializar, lecturas concurrentes verían el mismo valor y el contador quedaría < 4
+    expect(counter).toBe(4);
+  });
+});
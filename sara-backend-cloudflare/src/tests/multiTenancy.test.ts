@@ -7,8 +7,11 @@ import {
   resolveTenantFromRequest,
   resolveTenantById,
   resolveTenantsForCron,
+  invalidateTenant,
+  TenantContextCache,
 } from '../middleware/tenant';
 import type { TenantContext, TenantConfig } from '../middleware/tenant';
+import { hasValidApiKey } from '../utils/middleware';
 
 // ═══════════════════════════════════════════════════════════════════════════
 // MULTI-TENANCY TESTS — Phase 1 Foundation
@@ -194,10 +197,37 @@ describe('Multi-Tenancy Foundation', () => {
         headers: { 'X-Tenant-ID': 'bbbbbbbb-cccc-dddd-eeee-ffffffffffff' },
       });
       clearTenantCache();
-      const tenant = await resolveTenantFromRequest(mockRequest, mockSupabase as any);
+      const tenant = await resolveTenantFromRequest(mockRequest, mockSupabase as any, undefined, true);
       expect(tenant.tenantId).toBe('bbbbbbbb-cccc-dddd-eeee-ffffffffffff');
       expect(tenant.slug).toBe('header-tenant');
     });
+
+    it('ignores X-Tenant-ID on unauthenticated requests', async () => {
+      const mockTenant = {
+        id: 'bbbbbbbb-cccc-dddd-eeee-ffffffffffff',
+        slug: 'header-tenant',
+        name: 'Header Tenant',
+        timezone: 'America/Mexico_City',
+        plan: 'pro',
+        active: true,
+      };
+      const mockSupabase = createMockSupabase(mockTenant);
+      const mockRequest = new Request('https://api.example.com/api/leads', {
+        headers: { 'X-Tenant-ID': 'bbbbbbbb-cccc-dddd-eeee-ffffffffffff' },
+      });
+      clearTenantCache();
+      const tenant = await resolveTenantFromRequest(mockRequest, mockSupabase as any);
+      expect(tenant.tenantId).toBe(SANTA_RITA_TENANT_ID);
+    });
+
+    it('trusts X-Tenant-ID only with a valid API_SECRET', async () => {
+      const env = { API_SECRET: 'secret' } as any;
+      const headers = { 'X-Tenant-ID': 'bbbbbbbb-cccc-dddd-eeee-ffffffffffff' };
+      expect(hasValidApiKey(new Request('https://api.example.com/api/leads', { headers }), env)).toBe(false);
+      expect(hasValidApiKey(new Request('https://api.example.com/api/leads', { headers: { ...headers, Authorization: 'Bearer wrong' } }), env)).toBe(false);
+      expect(hasValidApiKey(new Request('https://api.example.com/api/leads', { headers: { ...headers, Authorization: 'Bearer secret' } }), env)).toBe(true);
+      expect(hasValidApiKey(new Request('https://api.example.com/api/leads', { headers: { Authorization: 'Bearer ' } }), {} as any)).toBe(false);
+    });
   });
 
   // ━━━ Tenant Resolution — By ID ━━━
@@ -276,6 +306,47 @@ describe('Multi-Tenancy Foundation', () => {
       await resolveTenantFromWebhook('clear_test', mockSupabase as any);
       expect(callCount).toBe(2); // Cache was cleared, so DB was called again
     });
+
+    it('invalidateTenant drops cached lookups for that tenant', async () => {
+      const mockTenant = {
+        id: 'eeeeeeee-ffff-0000-1111-333333333333',
+        slug: 'invalidate',
+        name: 'Invalidate',
+        timezone: 'America/Mexico_City',
+        plan: 'pro',
+        active: true,
+      };
+      let callCount = 0;
+      const mockSupabase = createMockSupabase(mockTenant, () => callCount++);
+
+      await resolveTenantFromWebhook('invalidate_test', mockSupabase as any);
+      await resolveTenantFromWebhook('invalidate_test', mockSupabase as any);
+      expect(callCount).toBe(1);
+
+      invalidateTenant(mockTenant.id);
+
+      await resolveTenantFromWebhook('invalidate_test', mockSupabase as any);
+      expect(callCount).toBe(2);
+    });
+
+    it('TenantContextCache expires entries after the TTL', () => {
+      const cache = new TenantContextCache(10, 0);
+      cache.set('id:a', getDefaultTenant());
+      expect(cache.get('id:a')).toBeUndefined();
+      expect(cache.getStats().misses).toBe(1);
+    });
+
+    it('TenantContextCache evicts the least recently used entry', () => {
+      const cache = new TenantContextCache(2, 60_000);
+      cache.set('id:a', getDefaultTenant());
+      cache.set('id:b', getDefaultTenant());
+      cache.get('id:a'); // a pasa a ser el más reciente
+      cache.set('id:c', getDefaultTenant());
+      expect(cache.get('id:b')).toBeUndefined();
+      expect(cache.get('id:a')).toBeDefined();
+      expect(cache.get('id:c')).toBeDefined();
+      expect(cache.getStats().size).toBe(2);
+    });
   });
 
   // ━━━ HandlerContext Integration ━━━
@@ -631,7 +702,7 @@ describe('Multi-Tenancy Foundation', () => {
 
   // ━━━ Resolution Priority ━━━
   describe('Resolution priority', () => {
-    it('X-Tenant-ID header takes priority over default', async () => {
+    it('X-Tenant-ID header (API_SECRET client) takes priority over default', async () => {
       clearTenantCache();
       const specificTenant = {
         id: 'eeeeeeee-eeee-eeee-eeee-eeeeeeeeeeee',
@@ -645,7 +716,7 @@ describe('Multi-Tenancy Foundation', () => {
       const request = new Request('https://api.example.com/api/leads', {
         headers: { 'X-Tenant-ID': 'eeeeeeee-eeee-eeee-eeee-eeeeeeeeeeee' },
       });
-      const tenant = await resolveTenantFromRequest(request, mockSupabase as any);
+      const tenant = await resolveTenantFromRequest(request, mockSupabase as any, undefined, true);
       expect(tenant.tenantId).toBe('eeeeeeee-eeee-eeee-eeee-eeeeeeeeeeee');
     });
 
@@ -0,0 +1,148 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  PDFReportService,
+  createLeadStatsAccumulator,
+  createPipelineAccumulator,
+  ReportConfig
+} from '../services/pdfReportService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// PDF REPORT SECTIONS TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+const LEAD_STATS = {
+  total: 10, assigned: 8, sales: 3, by_funnel: { new: 4, qualified: 3, negotiating: 3 },
+  closed: { count: 4, revenue: 8_000_000, avg_days: 12 },
+  sources: [{ source: 'Facebook', count: 6, sold: 2 }, { source: 'Google', count: 4, sold: 1 }],
+  developments: [{ development: 'Monte Verde', count: 10, sales: 3, closed: 4, revenue: 8_000_000 }],
+  vendors: [{ assigned_to: 'v1', leads: 8, sales: 3, closed: 4, revenue: 8_000_000 }],
+  hot: [{ name: 'Ana', score: 90, interest: 'Monte Verde' }]
+};
+const PIPELINE = {
+  total_value: 5_000_000, stages: [{ stage: 'negotiating', count: 2, value: 5_000_000 }],
+  expected_close_30d: 5_000_000, at_risk: [{ name: 'Luis', days_stuck: 20 }]
+};
+const APPOINTMENTS = {
+  scheduled: 5, completed: 4, no_show: 1,
+  developments: [{ development: 'Monte Verde', scheduled: 5, completed: 4 }],
+  vendors: [{ vendedor_id: 'v1', completed: 4 }]
+};
+
+function createSupabase(rpcImpl?: (name: string) => Promise<any>) {
+  const rpc = vi.fn(rpcImpl || (async (name: string) => ({
+    data: { pdf_report_lead_stats: LEAD_STATS, pdf_report_pipeline: PIPELINE, pdf_report_appointment_stats: APPOINTMENTS }[name],
+    error: null
+  })));
+  const from = vi.fn((table: string) => {
+    const chain: any = {};
+    for (const m of ['select', 'eq', 'gte', 'lte', 'lt', 'in', 'order', 'range']) chain[m] = () => chain;
+    const result = table === 'team_members'
+      ? { data: [{ id: 'v1', name: 'Carlos' }], error: null }
+      : table === 'monthly_goals'
+        ? { data: { company_goal: 6 }, error: null }
+        : { data: [], count: 2, error: null };
+    chain.single = () => Promise.resolve(result);
+    chain.then = (resolve: any) => resolve(result);
+    return chain;
+  });
+  return { supabase: { client: { from, rpc }, getTenantId: () => 't1' } as any, rpc, from };
+}
+
+async function readChunks(stream: ReadableStream<Uint8Array>): Promise<string[]> {
+  const reader = stream.getReader();
+  const decoder = new TextDecoder();
+  const chunks: string[] = [];
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    chunks.push(decoder.decode(value));
+  }
+  return chunks;
+}
+
+const withoutTimestamp = (html: string) => html.replace(/<strong>Generado:<\/strong>[^<]*/, '').replace(/\s+/g, ' ');
+
+describe('PDFReportService sections', () => {
+  it('should run each shared aggregate once for all sections', async () => {
+    const { supabase, rpc, from } = createSupabase();
+    const service = new PDFReportService(supabase);
+
+    const data = await service.generateReportData(service.getMonthlyReportConfig('CEO'));
+
+    expect(rpc.mock.calls.map(c => c[0]).sort()).toEqual(['pdf_report_appointment_stats', 'pdf_report_lead_stats', 'pdf_report_pipeline']);
+    expect(from.mock.calls.map(c => c[0]).sort()).toEqual(['leads', 'monthly_goals', 'team_members', 'vendor_monthly_goals']);
+    expect(data.summary).toMatchObject({ total_leads: 10, new_leads: 4, qualified_leads: 6, sales_closed: 4, conversion_rate: '40.0%', comparison_vs_previous: '+100% vs periodo anterior' });
+    expect(data.sales!.top_performers).toEqual([{ name: 'Carlos', sales: 4, revenue: 8_000_000 }]);
+    expect(data.team!.by_member[0]).toMatchObject({ name: 'Carlos', leads: 8, appointments: 4, sales: 3 });
+    expect(data.pipeline!.at_risk).toEqual([{ name: 'Luis', reason: 'Sin contacto', days_stuck: 20 }]);
+    expect(data.goals).toMatchObject({ company_goal: 6, current_sales: 3 });
+    expect(data.recommendations!.length).toBeGreaterThan(0);
+  });
+
+  it('should fold paged rows in the worker when the RPCs are missing', async () => {
+    const { supabase, from } = createSupabase(async () => ({ data: null, error: { code: 'PGRST202', message: 'missing' } }));
+    const service = new PDFReportService(supabase);
+    const config: ReportConfig = { ...service.getWeeklyReportConfig(), include_sections: ['leads_overview'] };
+
+    const data = await service.generateReportData(config);
+
+    expect(from).toHaveBeenCalledWith('leads');
+    expect(data.leads).toEqual({ by_status: [], by_source: [], by_development: [], hot_leads: [] });
+  });
+});
+
+describe('PDFReportService.streamHTML', () => {
+  it('should emit the head before aggregates resolve and match generateHTML', async () => {
+    let release: () => void = () => {};
+    const gate = new Promise<void>(r => { release = r; });
+    const { supabase } = createSupabase(async (name: string) => {
+      await gate;
+      return { data: { pdf_report_lead_stats: LEAD_STATS, pdf_report_pipeline: PIPELINE, pdf_report_appointment_stats: APPOINTMENTS }[name], error: null };
+    });
+    const service = new PDFReportService(supabase);
+    const config = service.getWeeklyReportConfig();
+
+    const reader = service.streamHTML(config).getReader();
+    const head = new TextDecoder().decode((await reader.read()).value);
+    expect(head).toContain('<title>Reporte Semanal de Ventas</title>');
+    expect(head).not.toContain('Resumen Ejecutivo');
+    release();
+    reader.releaseLock();
+
+    const streamed = head + (await readChunks(service.streamHTML(config))).slice(1).join('');
+    const html = service.generateHTML(await service.generateReportData(config));
+
+    expect(withoutTimestamp(streamed)).toBe(withoutTimestamp(html));
+    expect(streamed.indexOf('Top Vendedores')).toBeLessThan(streamed.indexOf('Avance de Meta'));
+    expect(streamed).toContain('Recomendaciones');
+  });
+});
+
+describe('report accumulators', () => {
+  it('should aggregate leads in one pass and keep only the top hot leads', () => {
+    const acc = createLeadStatsAccumulator();
+    for (let i = 0; i < 15; i++) {
+      acc.add({ name: `L${i}`, status: i < 2 ? 'sold' : 'new', source: i % 2 ? 'Facebook' : '', score: 60 + i, budget: '1000000', assigned_to: 'v1', created_at: '2026-01-01T00:00:00Z', updated_at: '2026-01-11T00:00:00Z' });
+    }
+    const stats = acc.result();
+
+    expect(stats.total).toBe(15);
+    expect(stats.sources).toEqual([{ source: 'Directo', count: 8, sold: 1 }, { source: 'Facebook', count: 7, sold: 1 }]);
+    expect(stats.closed).toEqual({ count: 2, revenue: 2_000_000, avg_days: 10 });
+    expect(stats.vendors).toEqual([{ assigned_to: 'v1', leads: 15, sales: 2, closed: 2, revenue: 2_000_000 }]);
+    expect(stats.hot.map(h => h.score)).toEqual([74, 73, 72, 71, 70]);
+  });
+
+  it('should skip inactive leads and rank at-risk leads by days stuck', () => {
+    const now = new Date('2026-03-31T00:00:00Z').getTime();
+    const acc = createPipelineAccumulator(now);
+    acc.add({ name: 'A', status: 'new', funnel_status: 'negotiating', budget: null, updated_at: '2026-03-01T00:00:00Z' });
+    acc.add({ name: 'B', status: 'new', funnel_status: 'new', budget: 1_000_000, last_activity_at: '2026-03-21T00:00:00Z' });
+    acc.add({ name: 'C', status: 'sold', funnel_status: 'reserved', budget: 9_000_000, updated_at: '2026-01-01T00:00:00Z' });
+    const stats = acc.result();
+
+    expect(stats.total_value).toBe(3_500_000);
+    expect(stats.expected_close_30d).toBe(2_500_000);
+    expect(stats.at_risk).toEqual([{ name: 'A', days_stuck: 30 }, { name: 'B', days_stuck: 10 }]);
+  });
+});
@@ -0,0 +1,116 @@
+import { describe, it, expect, vi } from 'vitest';
+import { HybridRateLimiter } from '../utils/rateLimiter';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// HYBRID RATE LIMITER TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function createMockKV(fail = false) {
+  const store = new Map<string, string>();
+  const kv = {
+    store,
+    get: vi.fn(async (key: string) => {
+      if (fail) throw new Error('KV down');
+      return store.get(key) ?? null;
+    }),
+    put: vi.fn(async (key: string, value: string) => {
+      if (fail) throw new Error('KV down');
+      store.set(key, value);
+    }),
+  };
+  return kv;
+}
+
+const T0 = 1_700_000_000_000 - (1_700_000_000_000 % 60_000); // inicio de ventana
+
+describe('HybridRateLimiter', () => {
+  it('decides requests far from the limit without touching KV', async () => {
+    const kv = createMockKV();
+    const limiter = new HybridRateLimiter(60_000, 0.1);
+
+    for (let i = 0; i < 5; i++) {
+      const d = await limiter.check(kv as any, 'ip:/api/leads', 100, false, undefined, T0 + i);
+      expect(d.allowed).toBe(true);
+    }
+    expect(kv.get).not.toHaveBeenCalled();
+    expect(limiter.getStats().local).toBe(5);
+  });
+
+  it('blocks once the limit is reached in the window', async () => {
+    const kv = createMockKV();
+    const limiter = new HybridRateLimiter(60_000, 0.1);
+
+    const results: boolean[] = [];
+    for (let i = 0; i < 12; i++) {
+      results.push((await limiter.check(kv as any, 'ip:/x', 10, false, undefined, T0 + i)).allowed);
+    }
+    expect(results.filter(Boolean)).toHaveLength(10);
+    expect(results.slice(10)).toEqual([false, false]);
+  });
+
+  it('counts requests from other isolates after syncing with KV', async () => {
+    const kv = createMockKV();
+    kv.store.set(`ratelimit:ip:/x:${T0 / 60_000}`, '9');
+    const limiter = new HybridRateLimiter(60_000, 0.1);
+
+    // headroom = 1: la primera request dispara el sync que trae los 9 de otros isolates
+    const pending: Promise<any>[] = [];
+    const first = await limiter.check(kv as any, 'ip:/x', 10, false, (p) => pending.push(p), T0);
+    expect(first.allowed).toBe(true);
+    await Promise.all(pending);
+    const second = await limiter.check(kv as any, 'ip:/x', 10, false, undefined, T0 + 1);
+    expect(second.allowed).toBe(false);
+  });
+
+  it('weights the previous window into the sliding estimate', async () => {
+    const kv = createMockKV();
+    const limiter = new HybridRateLimiter(60_000, 0.1);
+    for (let i = 0; i < 10; i++) {
+      await limiter.check(kv as any, 'ip:/x', 10, false, undefined, T0 + i);
+    }
+    // 6s dentro de la siguiente ventana: 90% de la anterior (9) sigue contando
+    expect((await limiter.check(kv as any, 'ip:/x', 10, false, undefined, T0 + 66_000)).allowed).toBe(true);
+    expect((await limiter.check(kv as any, 'ip:/x', 10, false, undefined, T0 + 66_001)).allowed).toBe(false);
+    // Al final de la ventana la anterior ya casi no pesa
+    const late = await limiter.check(kv as any, 'ip:/x', 10, false, undefined, T0 + 119_000);
+    expect(late.allowed).toBe(true);
+  });
+
+  it('fails closed for expensive routes when KV is unavailable', async () => {
+    const kv = createMockKV(true);
+    const limiter = new HybridRateLimiter(60_000, 0.1);
+    const d = await limiter.check(kv as any, 'ip:/test-ai-response', 10, true, undefined, T0);
+    expect(d.allowed).toBe(false);
+    expect(d.storeError).toContain('KV down');
+  });
+
+  it('fails open for default routes when KV is unavailable', async () => {
+    const kv = createMockKV(true);
+    const limiter = new HybridRateLimiter(60_000, 0.1);
+    const d = await limiter.check(kv as any, 'ip:/api/leads', 2, false, undefined, T0);
+    expect(d.allowed).toBe(true);
+    expect(d.storeError).toBeUndefined();
+  });
+
+  it('flushes local counts to KV in the background via waitUntil', async () => {
+    const kv = createMockKV();
+    const limiter = new HybridRateLimiter(60_000, 0.1);
+    const pending: Promise<any>[] = [];
+
+    for (let i = 0; i < 10; i++) {
+      await limiter.check(kv as any, 'ip:/api/leads', 100, false, (p) => pending.push(p), T0 + i);
+    }
+    await Promise.all(pending);
+    expect(pending).toHaveLength(1);
+    expect(kv.store.get(`ratelimit:ip:/api/leads:${T0 / 60_000}`)).toBe('10');
+  });
+
+  it('bounds the number of tracked keys', async () => {
+    const kv = createMockKV();
+    const limiter = new HybridRateLimiter(60_000, 0.1, 3);
+    for (let i = 0; i < 5; i++) {
+      await limiter.check(kv as any, `ip${i}:/x`, 100, false, undefined, T0);
+    }
+    expect(limiter.getStats().keys).toBe(3);
+  });
+});
@@ -0,0 +1,176 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  planReport,
+  planColumns,
+  validateReportConfig,
+  hashReportPlan,
+  buildReport,
+  runSavedReport,
+  streamReportCSV,
+  isReportDue,
+  ReportConfig,
+  SavedReport
+} from '../services/reportBuilderService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// REPORT QUERY PLANNER TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function createRpcSupabase(rpc: any) {
+  const from = vi.fn(() => {
+    const chain: any = {};
+    for (const m of ['select', 'eq', 'in', 'is', 'gte', 'lte', 'insert', 'single']) chain[m] = () => chain;
+    chain.then = (resolve: any) => resolve({ data: [{ id: '1', status: 'new' }], error: null });
+    return chain;
+  });
+  return { supabase: { client: { from, rpc }, getTenantId: () => 't1' } as any, from };
+}
+
+async function readText(stream: ReadableStream<Uint8Array>): Promise<string> {
+  const reader = stream.getReader();
+  const decoder = new TextDecoder();
+  let text = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    text += decoder.decode(value, { stream: true });
+  }
+  return text;
+}
+
+const CONFIG: ReportConfig = {
+  entity: 'leads',
+  metrics: ['count', 'sum'],
+  dimensions: ['status'],
+  filters: { source: ['facebook', 'google'], assigned_to: null, status: 'new' },
+  date_range: { from: '2026-01-01' },
+  sort: { field: 'sum_score', direction: 'desc' },
+  limit: 10,
+};
+
+const REPORT: SavedReport = {
+  id: 'r1', tenant_id: 't1', name: 'Leads', report_type: 'custom', config: CONFIG,
+  is_default: false, created_at: '', updated_at: ''
+};
+
+describe('planReport', () => {
+  it('should expand metrics over NUMERIC_FIELDS and type the filters', () => {
+    const plan = planReport(CONFIG);
+
+    expect(plan.metrics).toEqual([
+      { fn: 'count' },
+      { fn: 'sum', field: 'score' },
+      { fn: 'sum', field: 'budget_min' },
+      { fn: 'sum', field: 'budget_max' },
+    ]);
+    expect(plan.filters).toEqual([
+      { field: 'source', op: 'in', value: ['facebook', 'google'] },
+      { field: 'assigned_to', op: 'is_null' },
+      { field: 'status', op: 'eq', value: 'new' },
+    ]);
+    expect(plan.sort).toEqual({ key: 'sum_score', desc: true });
+    expect(planColumns(plan)).toEqual(['status', 'count', 'sum_score', 'sum_budget_min', 'sum_budget_max']);
+  });
+
+  it('should hash equal plans equally', async () => {
+    const a = await hashReportPlan(planReport(CONFIG));
+    const b = await hashReportPlan(planReport({ ...CONFIG }));
+    const c = await hashReportPlan(planReport({ ...CONFIG, limit: 5 }));
+    expect(a).toBe(b);
+    expect(a).not.toBe(c);
+    expect(a).toMatch(/^[0-9a-f]{64}$/);
+  });
+});
+
+describe('validateReportConfig', () => {
+  it('should reject identifiers outside the whitelist', () => {
+    expect(validateReportConfig(CONFIG)).toBeNull();
+    expect(validateReportConfig({ ...CONFIG, entity: 'team_members' as any })).toContain('Entidad');
+    expect(validateReportConfig({ ...CONFIG, dimensions: ['phone; drop table leads'] })).toContain('Dimensión');
+    expect(validateReportConfig({ ...CONFIG, filters: { password: 'x' } })).toContain('Filtro');
+    expect(validateReportConfig({ ...CONFIG, sort: { field: 'phone', direction: 'asc' } })).toContain('Orden');
+    expect(validateReportConfig({ ...CONFIG, metrics: ['median' as any] })).toContain('Métrica');
+  });
+});
+
+describe('buildReport with report_aggregate', () => {
+  it('should run one RPC and never read raw rows', async () => {
+    const rpc = vi.fn().mockResolvedValue({
+      data: { rows: [{ status: 'new', count: 2 }], totals: { count: 2 } },
+      error: null
+    });
+    const { supabase, from } = createRpcSupabase(rpc);
+
+    const result = await buildReport(supabase, { entity: 'leads', metrics: ['count'], dimensions: ['status'] });
+
+    expect(rpc).toHaveBeenCalledTimes(1);
+    expect(rpc.mock.calls[0][0]).toBe('report_aggregate');
+    expect(from).not.toHaveBeenCalled();
+    expect(result).toMatchObject({ rows: [{ status: 'new', count: 2 }], totals: { count: 2 }, row_count: 1 });
+  });
+
+  it('should fall back to worker aggregation when the RPC is missing', async () => {
+    const rpc = vi.fn().mockResolvedValue({ data: null, error: { code: 'PGRST202', message: 'not found' } });
+    const { supabase, from } = createRpcSupabase(rpc);
+
+    const result = await buildReport(supabase, { entity: 'leads', metrics: ['count'] });
+
+    expect(from).toHaveBeenCalledWith('leads');
+    expect(result.totals.count).toBe(1);
+  });
+
+  it('should fall back to worker aggregation when the RPC fails', async () => {
+    const rpc = vi.fn().mockResolvedValue({ data: null, error: { code: '57014', message: 'statement timeout' } });
+    const { supabase, from } = createRpcSupabase(rpc);
+
+    const result = await buildReport(supabase, { entity: 'leads', metrics: ['count'] });
+
+    expect(from).toHaveBeenCalledWith('leads');
+    expect(result.totals.count).toBe(1);
+  });
+});
+
+describe('runSavedReport', () => {
+  it('should return the materialized snapshot when nothing changed', async () => {
+    const cachedData = { rows: [{ count: 7 }], totals: { count: 7 }, row_count: 1, generated_at: '2026-03-01T00:00:00Z' };
+    const rpc = vi.fn().mockResolvedValue({ data: { data: cachedData, cached: true, snapshot_id: 's1' }, error: null });
+    const { supabase } = createRpcSupabase(rpc);
+
+    const run = await runSavedReport(supabase, REPORT);
+
+    expect(run).toEqual({ data: cachedData, cached: true, snapshot_id: 's1' });
+    expect(rpc.mock.calls[0][0]).toBe('report_run_snapshot');
+    expect(rpc.mock.calls[0][1]).toMatchObject({ p_report_id: 'r1', p_force: false, p_plan: planReport(CONFIG) });
+    expect(rpc.mock.calls[0][1].p_config_hash).toBe(await hashReportPlan(planReport(CONFIG)));
+  });
+});
+
+describe('streamReportCSV', () => {
+  it('should page report_aggregate until a short page and respect the limit', async () => {
+    const groups = Array.from({ length: 5 }, (_, i) => ({ status: `s${i}`, count: i }));
+    const rpc = vi.fn(async (_name: string, { p_plan }: any) => ({
+      data: { rows: groups.slice(p_plan.offset, p_plan.offset + p_plan.limit), totals: {} },
+      error: null
+    }));
+    const { supabase } = createRpcSupabase(rpc);
+
+    const csv = await readText(streamReportCSV(supabase, { entity: 'leads', metrics: ['count'], dimensions: ['status'], limit: 4 }, 2));
+
+    expect(csv.split('\n')).toEqual(['status,count', 's0,0', 's1,1', 's2,2', 's3,3']);
+    expect(rpc.mock.calls.map(c => [c[1].p_plan.offset, c[1].p_plan.limit, c[1].p_plan.totals])).toEqual([[0, 2, false], [2, 2, false]]);
+  });
+});
+
+describe('isReportDue', () => {
+  it('should follow the schedule frequency', () => {
+    const monday = new Date('2026-03-02T01:00:00Z');
+    const tuesday = new Date('2026-03-03T01:00:00Z');
+    const weekly = { frequency: 'weekly' as const, time: '08:00', recipients: [], active: true };
+
+    expect(isReportDue(weekly, monday)).toBe(true);
+    expect(isReportDue(weekly, tuesday)).toBe(false);
+    expect(isReportDue({ ...weekly, frequency: 'monthly' }, new Date('2026-03-01T01:00:00Z'))).toBe(true);
+    expect(isReportDue({ ...weekly, active: false }, monday)).toBe(false);
+    expect(isReportDue(undefined, monday)).toBe(false);
+  });
+});
@@ -231,6 +231,32 @@ describe('Reports CRON Module', () => {
 
       await expect(enviarReporteDiarioCEO(mockSupa as any, mockMeta as any)).resolves.not.toThrow();
     });
+
+    it('should read yesterday counts from the daily_metrics rollup', async () => {
+      const hoy = new Date();
+      const ayer = new Date(hoy.getFullYear(), hoy.getMonth(), hoy.getDate() - 1).toISOString().split('T')[0];
+      const mockSupa = createMockSupabase({
+        team_members: { data: [ADMIN_MEMBER], error: null },
+        daily_metrics: {
+          data: [
+            { day: ayer, vendedor_id: 'v1', development: 'Monte Verde', source: 'Facebook', leads_created: 3, sales_closed: 1, revenue: 2500000, appointments_total: 2, appointments_completed: 1 },
+            { day: ayer, vendedor_id: 'v2', development: 'Los Encinos', source: 'Google', leads_created: 2, sales_closed: 0, revenue: 0 },
+          ],
+          error: null,
+        },
+        leads: { data: [], error: null },
+        appointments: { data: [], error: null },
+        followup_approvals: { data: [], error: null },
+      });
+
+      await enviarReporteDiarioCEO(mockSupa as any, mockMeta as any);
+
+      const msg = (enviarMensajeTeamMember as any).mock.calls[0][3];
+      expect(msg).toContain('Leads nuevos: *5*');
+      expect(msg).toContain('Cierres: *1*');
+      expect(msg).toContain('Revenue: *$2.5M*');
+      expect(msg).toContain('Citas: 1/2 (50% show)');
+    });
   });
 
   // ═══════════════════════════════════════════════════════════════
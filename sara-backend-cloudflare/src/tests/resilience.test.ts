@@ -19,6 +19,7 @@ function createMockSupabase(overrides?: {
 
   return {
     client: {
+      rpc: legacyRpc(),
       from: vi.fn(() => ({
         insert: insertMock,
         select: vi.fn(() => ({
@@ -44,6 +45,11 @@ function createMockSupabase(overrides?: {
   };
 }
 
+// Scheduler RPC (migración 008) sin aplicar: processRetryQueue cae al modo legacy
+function legacyRpc() {
+  return vi.fn().mockResolvedValue({ data: null, error: { code: 'PGRST202', message: 'function not found' } });
+}
+
 function createMockMeta() {
   return {
     sendWhatsAppMessage: vi.fn().mockResolvedValue({ messages: [{ id: 'wamid.test' }] }),
@@ -150,6 +156,7 @@ describe('TEST 1: RETRY QUEUE', () => {
 
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
@@ -194,6 +201,7 @@ describe('TEST 1: RETRY QUEUE', () => {
 
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
@@ -237,6 +245,7 @@ describe('TEST 1: RETRY QUEUE', () => {
 
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
@@ -280,6 +289,7 @@ describe('TEST 1: RETRY QUEUE', () => {
 
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
@@ -337,6 +347,7 @@ describe('TEST 1: RETRY QUEUE', () => {
 
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
@@ -500,6 +511,7 @@ describe('TEST 1: RETRY QUEUE', () => {
     it('cola vacía retorna zeros sin error', async () => {
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
@@ -515,7 +527,7 @@ describe('TEST 1: RETRY QUEUE', () => {
       };
 
       const result = await processRetryQueue(mockSupabase as any, createMockMeta() as any, '5610016226');
-      expect(result).toEqual({ processed: 0, delivered: 0, failedPermanent: 0 });
+      expect(result).toEqual({ processed: 0, delivered: 0, failedPermanent: 0, rescheduled: 0 });
     });
   });
 });
@@ -906,6 +918,7 @@ describe('TEST 4: INTEGRACIÓN', () => {
 
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
@@ -970,6 +983,7 @@ describe('TEST 4: INTEGRACIÓN', () => {
 
       const mockSupabase = {
         client: {
+          rpc: legacyRpc(),
           from: vi.fn(() => ({
             select: vi.fn(() => ({
               eq: vi.fn(() => ({
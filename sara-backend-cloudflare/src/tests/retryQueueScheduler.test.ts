@@ -0,0 +1,156 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  processRetryQueue,
+  computeNextRetryAt,
+  RETRY_BASE_DELAY_MS,
+  RETRY_MAX_DELAY_MS,
+  RETRY_CONCURRENCY
+} from '../services/retryQueueService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// RETRY QUEUE SCHEDULER TESTS (claim con lease + sendMany + cierre en lote)
+// ═══════════════════════════════════════════════════════════════════════════
+
+function entry(id: string, overrides: Record<string, any> = {}) {
+  return {
+    id,
+    recipient_phone: `52156100000${id.slice(-2).padStart(2, '0')}`,
+    message_type: 'text',
+    payload: { body: `msg ${id}` },
+    context: '',
+    attempts: 0,
+    max_attempts: 3,
+    status: 'pending',
+    ...overrides
+  };
+}
+
+function createRpcSupabase(claimed: any[]) {
+  const rpc = vi.fn(async (fn: string, _args: any) => {
+    if (fn === 'claim_retry_queue') return { data: claimed, error: null };
+    if (fn === 'complete_retry_queue') return { data: claimed.length, error: null };
+    return { data: null, error: { code: 'PGRST202', message: 'not found' } };
+  });
+  const from = vi.fn();
+  return { supabase: { client: { rpc, from } } as any, rpc, from };
+}
+
+function completionsOf(rpc: ReturnType<typeof vi.fn>): any[] {
+  const call = rpc.mock.calls.find(c => c[0] === 'complete_retry_queue');
+  return call ? call[1].p_results : [];
+}
+
+describe('computeNextRetryAt', () => {
+  it('should grow exponentially with jitter between 50% and 100% of the step', () => {
+    const now = 1_000_000;
+    const lo = (a: number) => new Date(computeNextRetryAt(a, now, () => 0)).getTime() - now;
+    const hi = (a: number) => new Date(computeNextRetryAt(a, now, () => 1)).getTime() - now;
+
+    expect(lo(1)).toBe(RETRY_BASE_DELAY_MS / 2);
+    expect(hi(1)).toBe(RETRY_BASE_DELAY_MS);
+    expect(hi(2)).toBe(RETRY_BASE_DELAY_MS * 2);
+    expect(hi(3)).toBe(RETRY_BASE_DELAY_MS * 4);
+  });
+
+  it('should cap the delay at RETRY_MAX_DELAY_MS', () => {
+    const now = 0;
+    const delay = new Date(computeNextRetryAt(20, now, () => 1)).getTime() - now;
+    expect(delay).toBe(RETRY_MAX_DELAY_MS);
+  });
+});
+
+describe('processRetryQueue (scheduler)', () => {
+  it('should claim with a lease and redeliver through sendMany without requeue', async () => {
+    const { supabase, rpc } = createRpcSupabase([entry('e1'), entry('e2', { message_type: 'template', payload: { templateName: 'seguimiento_lead', components: [] } })]);
+    const meta = {
+      sendMany: vi.fn(async (jobs: any[]) => jobs.map((j, index) => ({ index, to: j.to, ok: true, result: { messages: [{ id: 'w' }] } }))),
+      sendWhatsAppMessage: vi.fn()
+    };
+
+    const result = await processRetryQueue(supabase, meta as any, '5610016226');
+
+    const claim = rpc.mock.calls.find(c => c[0] === 'claim_retry_queue')!;
+    expect(claim[1].p_lease_seconds).toBeGreaterThan(0);
+    expect(meta.sendMany).toHaveBeenCalledTimes(1);
+    const [jobs, options] = meta.sendMany.mock.calls[0];
+    expect(options).toMatchObject({ concurrency: RETRY_CONCURRENCY, requeue: false });
+    expect(jobs[0]).toMatchObject({ text: 'msg e1', bypassRateLimit: true });
+    expect(jobs[1].template).toMatchObject({ name: 'seguimiento_lead', languageCode: 'es_MX' });
+    expect(result).toMatchObject({ processed: 2, delivered: 2, failedPermanent: 0 });
+  });
+
+  it('should write all outcomes in a single complete_retry_queue call', async () => {
+    const { supabase, rpc, from } = createRpcSupabase([
+      entry('e1'),
+      entry('e2'),
+      entry('e3', { attempts: 2 }),
+      entry('e4', { message_type: 'sticker' })
+    ]);
+    const meta = {
+      sendMany: vi.fn(async () => [
+        { index: 0, to: 'a', ok: true, result: {} },
+        { index: 1, to: 'b', ok: false, error: 'Meta API Error: 503' },
+        { index: 2, to: 'c', ok: false, error: 'dead' }
+      ]),
+      sendWhatsAppMessage: vi.fn().mockResolvedValue({})
+    };
+
+    const result = await processRetryQueue(supabase, meta as any, '5610016226');
+
+    expect(rpc.mock.calls.filter(c => c[0] === 'complete_retry_queue')).toHaveLength(1);
+    expect(from).not.toHaveBeenCalled(); // sin UPDATE por fila
+    const byId = Object.fromEntries(completionsOf(rpc).map(c => [c.id, c]));
+    expect(byId.e1).toMatchObject({ status: 'delivered', attempts: 1 });
+    expect(byId.e2).toMatchObject({ status: 'pending', attempts: 1, last_error: 'Meta API Error: 503' });
+    expect(new Date(byId.e2.next_retry_at).getTime()).toBeGreaterThan(Date.now());
+    expect(byId.e3).toMatchObject({ status: 'failed_permanent', attempts: 3 });
+    expect(byId.e4.status).toBe('failed_permanent');
+    expect(result).toMatchObject({ processed: 4, delivered: 1, failedPermanent: 2 });
+
+    // Una sola alerta al dev por corrida
+    expect(meta.sendWhatsAppMessage).toHaveBeenCalledTimes(1);
+    expect(meta.sendWhatsAppMessage.mock.calls[0][1]).toContain('RETRY QUEUE');
+  });
+
+  it('should reschedule rate-limited sends without spending an attempt', async () => {
+    const { supabase, rpc } = createRpcSupabase([entry('e1', { attempts: 1 })]);
+    const meta = {
+      sendMany: vi.fn(async () => [{ index: 0, to: 'a', ok: true, result: { rate_limited: true, enqueued: true } }]),
+      sendWhatsAppMessage: vi.fn()
+    };
+
+    const result = await processRetryQueue(supabase, meta as any, '5610016226');
+
+    expect(result.rescheduled).toBe(1);
+    expect(result.delivered).toBe(0);
+    expect(completionsOf(rpc)[0]).toMatchObject({ status: 'pending', attempts: 1 });
+  });
+
+  it('should not call sendMany when nothing is due', async () => {
+    const { supabase, rpc } = createRpcSupabase([]);
+    const meta = { sendMany: vi.fn() };
+
+    const result = await processRetryQueue(supabase, meta as any, '5610016226');
+
+    expect(meta.sendMany).not.toHaveBeenCalled();
+    expect(rpc.mock.calls.filter(c => c[0] === 'complete_retry_queue')).toHaveLength(0);
+    expect(result.processed).toBe(0);
+  });
+
+  it('should fall back to the legacy path when the claim RPC is not deployed', async () => {
+    const limit = vi.fn().mockResolvedValue({ data: [], error: null });
+    const supabase = {
+      client: {
+        rpc: vi.fn().mockResolvedValue({ data: null, error: { code: 'PGRST202', message: 'Could not find the function' } }),
+        from: vi.fn(() => ({
+          select: vi.fn(() => ({ eq: vi.fn(() => ({ lt: vi.fn(() => ({ order: vi.fn(() => ({ limit })) })) })) }))
+        }))
+      }
+    } as any;
+
+    const result = await processRetryQueue(supabase, { sendMany: vi.fn() } as any, '5610016226');
+
+    expect(limit).toHaveBeenCalledWith(10);
+    expect(result.processed).toBe(0);
+  });
+});
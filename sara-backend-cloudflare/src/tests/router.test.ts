@@ -0,0 +1,88 @@
+import { describe, it, expect, vi, beforeEach } from 'vitest';
+import { compileRoutes, routePolicy, getRouteTimings, resetRouteTimings } from '../utils/router';
+import type { RouteDef } from '../utils/router';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// COMPILED ROUTER TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function ok(body: string) {
+  return vi.fn(async () => new Response(body));
+}
+
+function none() {
+  return vi.fn(async () => null);
+}
+
+describe('CompiledRouter', () => {
+  beforeEach(() => resetRouteTimings());
+
+  it('should match exact paths and prefixes in declaration order', () => {
+    const meta = ok('meta');
+    const test = none();
+    const bi = none();
+    const routes: RouteDef<any>[] = [
+      { name: 'meta', method: 'POST', path: '/webhook/meta', auth: 'public', rateLimit: 'default', handler: meta },
+      { name: 'test', path: '/test-*', auth: 'api_key', rateLimit: 'default', handler: test },
+      { name: 'bi', path: '/test-*', auth: 'api_key', rateLimit: 'default', handler: bi },
+      { name: 'bi', path: '/status', auth: 'public', rateLimit: 'default', handler: bi },
+    ];
+    const router = compileRoutes(routes);
+
+    expect(router.match('/webhook/meta').map(r => r.name)).toEqual(['meta']);
+    expect(router.match('/webhook/meta/extra')).toEqual([]);
+    expect(router.match('/test-lead').map(r => r.name)).toEqual(['test', 'bi']);
+    expect(router.match('/status').map(r => r.name)).toEqual(['bi']);
+    expect(router.match('/statuses')).toEqual([]);
+    expect(router.match('/unknown')).toEqual([]);
+  });
+
+  it('should dispatch until a handler responds, once per handler and method', async () => {
+    const shared = none();
+    const target = ok('found');
+    const postOnly = ok('post');
+    const router = compileRoutes<any>([
+      { name: 'post_only', method: 'POST', path: '/api/leads', auth: 'path', rateLimit: 'default', handler: postOnly },
+      { name: 'core', path: '/api/leads*', auth: 'path', rateLimit: 'default', handler: shared },
+      { name: 'core', path: '/api/*', auth: 'path', rateLimit: 'default', handler: shared },
+      { name: 'tasks', path: '/api/leads*', auth: 'path', rateLimit: 'default', handler: target },
+    ]);
+
+    const response = await router.dispatch(router.match('/api/leads'), 'GET', {});
+
+    expect(await response!.text()).toBe('found');
+    expect(postOnly).not.toHaveBeenCalled();
+    expect(shared).toHaveBeenCalledTimes(1);
+    expect(await router.dispatch(router.match('/other'), 'GET', {})).toBeNull();
+  });
+
+  it('should record per-route timings', async () => {
+    const router = compileRoutes<any>([
+      { name: 'health', path: '/health', auth: 'public', rateLimit: 'default', handler: ok('ok') },
+    ]);
+
+    await router.dispatch(router.match('/health'), 'GET', {});
+    await router.dispatch(router.match('/health'), 'GET', {});
+
+    expect(getRouteTimings().health).toMatchObject({ count: 2 });
+  });
+});
+
+describe('routePolicy', () => {
+  const handler = none();
+
+  it('should take the strictest rate limit and auth among candidates', () => {
+    const policy = routePolicy<any>([
+      { name: 'test', path: '/test-*', auth: 'api_key', rateLimit: 'default', handler },
+      { name: 'load', path: '/test-load-test', auth: 'path', rateLimit: 'load_test', handler },
+    ]);
+
+    expect(policy).toEqual({ rateLimit: 'load_test', auth: 'api_key' });
+  });
+
+  it('should keep webhooks public and defer unmatched paths to requiresAuth', () => {
+    expect(routePolicy<any>([{ name: 'meta', path: '/webhook/meta', auth: 'public', rateLimit: 'default', handler }]))
+      .toEqual({ rateLimit: 'default', auth: 'public' });
+    expect(routePolicy([])).toEqual({ rateLimit: 'default', auth: 'path' });
+  });
+});
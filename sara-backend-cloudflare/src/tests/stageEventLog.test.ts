@@ -0,0 +1,137 @@
+import { describe, it, expect, vi } from 'vitest';
+import { FunnelVelocityService } from '../services/funnelVelocityService';
+import { RevenueAttributionService } from '../services/revenueAttributionService';
+import { CustomerValueService } from '../services/customerValueService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// LEAD STAGE EVENT LOG TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+function createSupabase(rpcResult: Record<string, any>, tables: Record<string, any> = {}) {
+  const calls: { table: string; method: string; args: any[] }[] = [];
+  const rpc = vi.fn(async (name: string) => rpcResult[name] || { data: null, error: { code: 'PGRST202', message: 'missing' } });
+  const from = vi.fn((table: string) => {
+    const chain: any = {};
+    for (const m of ['select', 'update', 'eq', 'is', 'gte', 'lte', 'in', 'not', 'order', 'limit']) {
+      chain[m] = (...args: any[]) => { calls.push({ table, method: m, args }); return chain; };
+    }
+    const result = tables[table] || { data: [], error: null };
+    chain.single = () => Promise.resolve(result);
+    chain.then = (resolve: any) => resolve(result);
+    return chain;
+  });
+  const updateLead = vi.fn(async () => ({}));
+  const getLeadById = vi.fn(async () => ({ id: 'l1', notes: {} }));
+  return { supabase: { client: { from, rpc }, updateLead, getLeadById } as any, rpc, from, calls, updateLead };
+}
+
+describe('FunnelVelocityService with stage events', () => {
+  it('should map the velocity summary without scanning leads', async () => {
+    const { supabase, from } = createSupabase({
+      funnel_velocity_summary: {
+        data: {
+          stages: [
+            { stage: 'new', avg_days: 2.04, median_days: 1.5, exits: 10, advanced: 8 },
+            { stage: 'negotiation', avg_days: 9.26, median_days: 7, exits: 4, advanced: 1 }
+          ],
+          current: { new: 5, negotiation: 2 },
+          close: { avg_days: 30.44, count: 3 },
+          vendors: [{ assigned_to: 'v1', avg_days: 20 }, { assigned_to: 'v2', avg_days: 40 }]
+        },
+        error: null
+      }
+    }, { team_members: { data: [{ id: 'v1', name: 'Ana' }, { id: 'v2', name: 'Luis' }], error: null } });
+
+    const report = await new FunnelVelocityService(supabase).calculateVelocity('month');
+
+    expect(from.mock.calls.map(c => c[0])).toEqual(['team_members']);
+    expect(report.stages.find(s => s.stage === 'new')).toEqual({
+      stage: 'new', avgDaysInStage: 2, medianDaysInStage: 1.5, leadsCurrentlyInStage: 5, conversionRateToNext: 80
+    });
+    expect(report.overallAvgDaysToClose).toBe(30.4);
+    expect(report.bottleneckStage).toBe('negotiation');
+    expect(report.fastestVendedor).toEqual({ name: 'Ana', avgDays: 20 });
+    expect(report.slowestVendedor).toEqual({ name: 'Luis', avgDays: 40 });
+  });
+
+  it('should fall back to the leads rescan when the summary RPC is missing', async () => {
+    const { supabase, from } = createSupabase({});
+
+    const report = await new FunnelVelocityService(supabase).calculateVelocity('week');
+
+    expect(from).toHaveBeenCalledWith('leads');
+    expect(report.stages.every(s => s.leadsCurrentlyInStage === 0)).toBe(true);
+  });
+
+  it('should tag the trigger-written event instead of rewriting notes', async () => {
+    const { supabase, calls, updateLead } = createSupabase({});
+
+    await new FunnelVelocityService(supabase).recordTransition('l1', 'new', 'contacted', 'vendor');
+
+    expect(calls.find(c => c.method === 'update')).toMatchObject({ table: 'lead_stage_events', args: [{ triggered_by: 'vendor' }] });
+    expect(updateLead).not.toHaveBeenCalled();
+  });
+
+  it('should keep the notes write when the event log table is missing', async () => {
+    const { supabase, updateLead } = createSupabase({}, {
+      lead_stage_events: { data: null, error: { code: '42P01', message: 'relation does not exist' } }
+    });
+
+    await new FunnelVelocityService(supabase).recordTransition('l1', 'new', 'contacted', 'vendor');
+
+    expect(updateLead).toHaveBeenCalledWith('l1', expect.objectContaining({
+      notes: expect.objectContaining({ stage_transitions: [expect.objectContaining({ from: 'new', to: 'contacted' })] })
+    }));
+  });
+});
+
+describe('RevenueAttributionService with stage events', () => {
+  it('should map attribution rows and derive ROAS and cost per lead', async () => {
+    const { supabase, from } = createSupabase({
+      revenue_attribution_summary: {
+        data: [
+          { channel: 'organic', campaigns: null, leads: 5, closed: 1, revenue: 1_000_000, spend: 0, avg_days_to_close: 10 },
+          { channel: 'facebook', campaigns: 'promo', leads: 10, closed: 2, revenue: 4_000_000, spend: 20_000, avg_days_to_close: 12.34 }
+        ],
+        error: null
+      }
+    });
+
+    const report = await new RevenueAttributionService(supabase).getAttributionReport('month');
+
+    expect(from).not.toHaveBeenCalled();
+    expect(report.map(r => r.channel)).toEqual(['facebook', 'organic']);
+    expect(report[0]).toEqual({
+      channel: 'facebook', campaign: 'promo', leads: 10, closed: 2, revenue: 4_000_000,
+      roas: 200, costPerLead: 2_000, costPerSale: 10_000, avgDaysToClose: 12.3
+    });
+    expect(report[1].roas).toBe(-1);
+  });
+});
+
+describe('CustomerValueService with stage events', () => {
+  it('should build the CLV analysis from one summary call', async () => {
+    const { supabase, from, rpc } = createSupabase({
+      clv_summary: {
+        data: {
+          total_customers: 2, total_clv: 6_000_000, total_referrals: 3, converted_referrals: 1, referral_revenue: 2_000_000,
+          top_referrers: [{ name: 'Ana', referrals: 3, conversions: 1, value_generated: 2_000_000 }],
+          customers: [
+            { id: 'c1', name: 'Ana', phone: '521', status: 'sold', budget: 4_000_000, updated_at: '2026-10-01T00:00:00Z', referrals_made: 3, referral_conversions: 1, referral_value: 2_000_000, total_interactions: 12 },
+            { id: 'c2', name: 'Luis', phone: '522', status: 'delivered', budget: 2_000_000, updated_at: '2026-10-01T00:00:00Z', referred_by_name: 'Ana', total_interactions: 4 }
+          ]
+        },
+        error: null
+      }
+    });
+
+    const analysis = await new CustomerValueService(supabase).getCLVAnalysis();
+
+    expect(rpc).toHaveBeenCalledWith('clv_summary', { p_top: 20 });
+    expect(from).not.toHaveBeenCalled();
+    expect(analysis.avg_clv).toBe(3_000_000);
+    expect(analysis.referrals.conversion_rate).toBe('33.3%');
+    expect(analysis.top_customers[0]).toMatchObject({ id: 'c1', lifetime_value: 6_000_000, referrals_made: 3, total_interactions: 12 });
+    expect(analysis.top_customers[1]).toMatchObject({ id: 'c2', referred_by: 'Ana' });
+  });
+});
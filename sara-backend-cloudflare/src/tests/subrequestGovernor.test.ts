@@ -0,0 +1,173 @@
+import { describe, it, expect, vi } from 'vitest';
+import {
+  SubrequestGovernor,
+  SUBREQUEST_LIMIT,
+  SUBREQUEST_RESERVE
+} from '../services/subrequestGovernor';
+import { CronTracker } from '../services/observabilityService';
+
+// ═══════════════════════════════════════════════════════════════════════════
+// SUBREQUEST GOVERNOR TESTS
+// ═══════════════════════════════════════════════════════════════════════════
+
+describe('SubrequestGovernor', () => {
+  it('should count subrequests by kind', () => {
+    const governor = new SubrequestGovernor();
+    governor.record('fetch', 3);
+    governor.record('kv');
+    governor.record('r2', 2);
+
+    const summary = governor.getSummary();
+    expect(summary.used).toBe(6);
+    expect(summary.byKind).toEqual({ fetch: 3, kv: 1, r2: 2 });
+    expect(summary.remaining).toBe(SUBREQUEST_LIMIT - SUBREQUEST_RESERVE - 6);
+  });
+
+  it('should answer canAfford against the global budget minus reserve', () => {
+    const governor = new SubrequestGovernor(100, 10);
+    governor.record('fetch', 80);
+    expect(governor.canAfford(10)).toBe(true);
+    expect(governor.canAfford(11)).toBe(false);
+  });
+
+  it('should enforce per-task budgets in canAfford', () => {
+    const governor = new SubrequestGovernor();
+    governor.beginTask('broadcast', { budget: 20 });
+    governor.record('fetch', 15);
+    expect(governor.canAfford(5)).toBe(true);
+    expect(governor.canAfford(6)).toBe(false);
+    governor.endTask();
+    // Outside the task only the global budget applies
+    expect(governor.canAfford(6)).toBe(true);
+  });
+
+  it('should flag tasks that exceed their budget', () => {
+    const governor = new SubrequestGovernor();
+    const task = governor.beginTask('reporte', { budget: 2 });
+    governor.record('fetch', 3);
+    governor.endTask();
+    expect(task.overBudget).toBe(true);
+    expect(task.used).toBe(3);
+  });
+
+  it('should defer low-priority tasks when the budget is low', () => {
+    const governor = new SubrequestGovernor(300, 50, 200);
+    governor.record('fetch', 100); // remaining = 150 < floor 200
+    expect(governor.shouldRun('videos', { priority: 'low' })).toBe(false);
+    expect(governor.shouldRun('reporteCEO', { priority: 'critical' })).toBe(true);
+    expect(governor.shouldRun('recordatorios')).toBe(true);
+    expect(governor.getSummary().deferred).toEqual(['videos']);
+  });
+
+  it('should count KV and R2 binding calls through wrapEnv', async () => {
+    const governor = new SubrequestGovernor();
+    const kv = { get: vi.fn().mockResolvedValue('1'), put: vi.fn().mockResolvedValue(undefined) };
+    const r2 = { put: vi.fn().mockResolvedValue({}), list: vi.fn().mockResolvedValue({ objects: [] }) };
+    const env = governor.wrapEnv({ SARA_CACHE: kv as any, SARA_BACKUPS: r2 as any, SUPABASE_URL: 'x' });
+
+    await env.SARA_CACHE!.get('a');
+    await env.SARA_CACHE!.put('a', '1');
+    await env.SARA_BACKUPS!.list();
+
+    expect(kv.get).toHaveBeenCalledWith('a');
+    expect(env.SUPABASE_URL).toBe('x');
+    expect(governor.getSummary().byKind).toEqual({ fetch: 0, kv: 2, r2: 1 });
+  });
+
+  it('should count global fetch while installed and restore it after', async () => {
+    const originalFetch = globalThis.fetch;
+    const mockFetch = vi.fn().mockResolvedValue(new Response('ok'));
+    globalThis.fetch = mockFetch as any;
+    try {
+      const governor = new SubrequestGovernor();
+      governor.install();
+      await fetch('https://example.com/a');
+      await fetch('https://example.com/b');
+      governor.uninstall();
+      await fetch('https://example.com/c');
+
+      expect(mockFetch).toHaveBeenCalledTimes(3);
+      expect(governor.getUsed()).toBe(2);
+      expect(globalThis.fetch).toBe(mockFetch);
+    } finally {
+      globalThis.fetch = originalFetch;
+    }
+  });
+
+  it('should share one fetch patch between overlapping governors', async () => {
+    const originalFetch = globalThis.fetch;
+    const mockFetch = vi.fn().mockResolvedValue(new Response('ok'));
+    globalThis.fetch = mockFetch as any;
+    try {
+      const first = new SubrequestGovernor();
+      const second = new SubrequestGovernor();
+      first.install();
+      second.install();
+      await fetch('https://example.com/a');
+      first.uninstall(); // el segundo sigue contando
+      await fetch('https://example.com/b');
+      second.uninstall();
+      await fetch('https://example.com/c');
+
+      expect(first.getUsed()).toBe(1);
+      expect(second.getUsed()).toBe(2);
+      expect(globalThis.fetch).toBe(mockFetch);
+    } finally {
+      globalThis.fetch = originalFetch;
+    }
+  });
+
+  it('should defer normal tasks whose budget no longer fits, never critical ones', () => {
+    const governor = new SubrequestGovernor(300, 50, 200);
+    governor.record('fetch', 100); // remaining = 150
+    expect(governor.shouldRun('broadcast', { budget: 200 })).toBe(false);
+    expect(governor.shouldRun('alertas', { budget: 100 })).toBe(true);
+    expect(governor.shouldRun('reporteCEO', { priority: 'critical', budget: 500 })).toBe(true);
+  });
+});
+
+describe('CronTracker with SubrequestGovernor', () => {
+  it('should record per-task subrequest consumption', async () => {
+    const governor = new SubrequestGovernor();
+    const tracker = new CronTracker('0 14 * * 1-5', governor);
+
+    await tracker.track('briefings', async () => { governor.record('fetch', 12); });
+    await tracker.track('alertas', async () => { governor.record('kv', 3); });
+
+    const summary = tracker.getSummary();
+    expect(summary.tasks[0].subrequests).toBe(12);
+    expect(summary.tasks[1].subrequests).toBe(3);
+    expect(summary.subrequests?.used).toBe(15);
+  });
+
+  it('should mark deferred tasks without running them', async () => {
+    const governor = new SubrequestGovernor(250, 50, 200);
+    governor.record('fetch', 10);
+    const tracker = new CronTracker('*/2 * * * *', governor);
+    const fn = vi.fn().mockResolvedValue(undefined);
+
+    await tracker.track('procesarBroadcastQueue', fn, { priority: 'low' });
+
+    const summary = tracker.getSummary();
+    expect(fn).not.toHaveBeenCalled();
+    expect(summary.tasks[0].deferred).toBe(true);
+    expect(summary.deferredCount).toBe(1);
+    expect(summary.successCount).toBe(0);
+    expect(summary.failCount).toBe(0);
+  });
+
+  it('should persist subrequest usage for capacity planning', async () => {
+    const insertSpy = vi.fn().mockResolvedValue({ error: null });
+    const supabase = { client: { from: () => ({ insert: insertSpy }) } } as any;
+    const governor = new SubrequestGovernor();
+    const tracker = new CronTracker('*/2 * * * *', governor);
+
+    await tracker.track('task1', async () => { governor.record('fetch', 4); });
+    await tracker.persist(supabase);
+
+    const row = insertSpy.mock.calls[0][0];
+    expect(row.datos.tasks[0].subrequests).toBe(4);
+    expect(row.datos.subrequests.used).toBe(4);
+    expect(row.datos.subrequests.limit).toBe(SUBREQUEST_LIMIT);
+  });
+});
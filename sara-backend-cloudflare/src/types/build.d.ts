@@ -0,0 +1,3 @@
+// Constantes reemplazadas en build por el [define] de wrangler.toml
+// false en producción: esbuild elimina las rutas test/debug del bundle
+declare const __DEBUG_ROUTES__: boolean;
@@ -8,6 +8,7 @@ export interface Env {
   // ── Supabase ──
   SUPABASE_URL: string;
   SUPABASE_ANON_KEY: string;
+  SUPABASE_JWT_SECRET?: string; // Firma el claim tenant_id (current_tenant_id, migración 018)
 
   // ── Anthropic (Claude) ──
   ANTHROPIC_API_KEY: string;
@@ -35,6 +36,10 @@ export interface Env {
   // ── Cloudflare Bindings ──
   SARA_CACHE?: KVNamespace;
   SARA_BACKUPS?: R2Bucket;
+  META_INBOUND_QUEUE?: Queue<any>; // Cola de ingesta del webhook Meta (ack-first)
+
+  // ── Ingesta webhook ──
+  META_ACK_FIRST?: string; // 'true' = ack-first con cola en memoria si no hay META_INBOUND_QUEUE
 
   // ── Sentry ──
   SENTRY_DSN?: string;
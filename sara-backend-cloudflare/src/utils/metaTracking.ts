@@ -1,18 +1,35 @@
-import { MetaWhatsAppService } from '../services/meta-whatsapp';
+import { MetaWhatsAppService, MessageTrackingCallback } from '../services/meta-whatsapp';
 import { SupabaseService } from '../services/supabase';
-import { createMessageTrackingService } from '../services/messageTrackingService';
-import { enqueueFailedMessage } from '../services/retryQueueService';
+import { createMessageTrackingService, createMessageTrackingBuffer, MessageTrackingBuffer, MessageData } from '../services/messageTrackingService';
+import { enqueueFailedMessage, enqueueFailedMessages } from '../services/retryQueueService';
 import { TenantConfig } from '../middleware/tenant';
 import { incrementMetric, checkMessageLimit } from '../services/usageTrackingService';
 
+/**
+ * Tracking buffer for one request / CRON invocation.
+ * Flushes through ctx.waitUntil and bumps the SaaS messages_sent metric once per flush.
+ */
+export function createRequestTrackingBuffer(
+  supabase: SupabaseService,
+  ctx?: { waitUntil(promise: Promise<any>): void }
+): MessageTrackingBuffer {
+  return createMessageTrackingBuffer(supabase, {
+    waitUntil: ctx ? (p) => ctx.waitUntil(p) : undefined,
+    onSentFlushed: async (count) => { await incrementMetric(supabase, 'messages_sent', count); }
+  });
+}
+
 /**
  * Create Meta service using tenant config (preferred) with env fallback.
  * If tenantConfig has WhatsApp credentials, those are used; otherwise env vars.
+ * With a trackingBuffer, messages_sent rows are buffered and flushed in batches
+ * instead of one insert per send.
  */
 export async function createMetaWithTracking(
   env: any,
   supabase: SupabaseService,
-  tenantConfig?: TenantConfig
+  tenantConfig?: TenantConfig,
+  trackingBuffer?: MessageTrackingBuffer
 ): Promise<MetaWhatsAppService> {
   const phoneNumberId = tenantConfig?.whatsappPhoneNumberId || env.META_PHONE_NUMBER_ID;
   const accessToken = tenantConfig?.whatsappAccessToken || env.META_ACCESS_TOKEN;
@@ -33,11 +50,9 @@ export async function createMetaWithTracking(
 
   // Configurar tracking automático de mensajes con auto-detect recipientType
   const msgTracking = createMessageTrackingService(supabase);
-  meta.setTrackingCallback(async (data) => {
-    const phoneSuffix = data.recipientPhone.slice(-10);
-    const tm = tmPhoneMap.get(phoneSuffix);
-
-    await msgTracking.logMessageSent({
+  const toMessageData = (data: Parameters<MessageTrackingCallback>[0]): MessageData => {
+    const tm = tmPhoneMap.get(data.recipientPhone.slice(-10));
+    return {
       messageId: data.messageId,
       recipientPhone: data.recipientPhone,
       recipientType: tm ? 'team_member' : 'lead',
@@ -46,11 +61,32 @@ export async function createMetaWithTracking(
       messageType: data.messageType,
       categoria: data.categoria,
       contenido: data.contenido
+    };
+  };
+
+  if (trackingBuffer) {
+    // Buffer: sin I/O en el envío; el flush (multi-row) corre en waitUntil
+    meta.setTrackingCallback(async (data) => {
+      trackingBuffer.addSent(toMessageData(data));
     });
+    meta.setBatchTrackingCallback(async (items) => {
+      for (const data of items) trackingBuffer.addSent(toMessageData(data));
+    });
+  } else {
+    meta.setTrackingCallback(async (data) => {
+      await msgTracking.logMessageSent(toMessageData(data));
 
-    // Increment SaaS usage metric (non-blocking, fire-and-forget)
-    incrementMetric(supabase, 'messages_sent').catch(() => {});
-  });
+      // Increment SaaS usage metric (non-blocking, fire-and-forget)
+      incrementMetric(supabase, 'messages_sent').catch(() => {});
+    });
+
+    // sendMany(): un solo insert para todo el lote
+    meta.setBatchTrackingCallback(async (items) => {
+      await msgTracking.logMessagesSent(items.map(toMessageData));
+
+      incrementMetric(supabase, 'messages_sent', items.length).catch(() => {});
+    });
+  }
 
   // Check message limit before each send (uses 5min cache to avoid DB spam)
   meta.setPreSendCheck(async () => {
@@ -76,6 +112,10 @@ export async function createMetaWithTracking(
     );
   });
 
+  meta.setBatchFailedMessageCallback(async (items) => {
+    await enqueueFailedMessages(supabase, items);
+  });
+
   // Configurar KV para rate limiting global de Meta API
   if (env.SARA_CACHE) {
     meta.setKVNamespace(env.SARA_CACHE);
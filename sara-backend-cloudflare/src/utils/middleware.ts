@@ -6,6 +6,7 @@
 import type { Env } from '../types/env';
 import { SupabaseService } from '../services/supabase';
 import { MetaWhatsAppService } from '../services/meta-whatsapp';
+import { HybridRateLimiter, RATE_LIMIT_WINDOW_MS } from './rateLimiter';
 
 // ═══════════════════════════════════════════════════════════════════════════
 // CORS
@@ -30,14 +31,20 @@ export function getCorsOrigin(request: Request): string {
   return ALLOWED_CRM_ORIGINS[0];
 }
 
+/** Headers CORS de las respuestas del CRM (también para streams que no pasan por corsResponse) */
+export function corsHeaders(request?: Request): Record<string, string> {
+  return {
+    'Access-Control-Allow-Origin': request ? getCorsOrigin(request) : '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Request-ID',
+  };
+}
+
 export function corsResponse(body: string | null, status: number = 200, contentType: string = 'application/json', request?: Request): Response {
-  const allowedOrigin = request ? getCorsOrigin(request) : '*';
   return new Response(body, {
     status,
     headers: {
-      'Access-Control-Allow-Origin': allowedOrigin,
-      'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-      'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Request-ID',
+      ...corsHeaders(request),
       'Content-Type': contentType,
     },
   });
@@ -76,7 +83,14 @@ export function log(level: 'info' | 'warn' | 'error', message: string, requestId
 // RATE LIMITING
 // ═══════════════════════════════════════════════════════════════════════════
 
-export async function checkRateLimit(request: Request, env: Env, requestId: string, maxRequests: number = 100, failClosed: boolean = false): Promise<Response | null> {
+// Un limiter por isolate: decide en memoria y reconcilia con KV (ver utils/rateLimiter.ts)
+const rateLimiter = new HybridRateLimiter();
+
+export function getRateLimiterStats() {
+  return rateLimiter.getStats();
+}
+
+export async function checkRateLimit(request: Request, env: Env, requestId: string, maxRequests: number = 100, failClosed: boolean = false, ctx?: ExecutionContext): Promise<Response | null> {
   if (!env.SARA_CACHE) return null;
 
   const url = new URL(request.url);
@@ -98,45 +112,38 @@ export async function checkRateLimit(request: Request, env: Env, requestId: stri
       }
     } catch {}
   }
-  const key = `ratelimit:${ip}${tenantSuffix}:${endpoint}`;
+  const key = `${ip}${tenantSuffix}:${endpoint}`;
   const limit = maxRequests;
-  const windowSeconds = 60;
-
-  try {
-    const current = await env.SARA_CACHE.get(key);
-    const count = current ? parseInt(current, 10) : 0;
-
-    if (count >= limit) {
-      log('warn', `Rate limit exceeded for IP: ${ip}`, requestId, { ip, count, limit, endpoint });
-      return new Response(JSON.stringify({
-        error: 'Too many requests',
-        retry_after: windowSeconds
-      }), {
-        status: 429,
-        headers: {
-          'Content-Type': 'application/json',
-          'Retry-After': String(windowSeconds),
-          'X-RateLimit-Limit': String(limit),
-          'X-RateLimit-Remaining': '0',
-        }
-      });
-    }
+  const windowSeconds = RATE_LIMIT_WINDOW_MS / 1000;
+
+  const decision = await rateLimiter.check(env.SARA_CACHE, key, limit, failClosed, ctx ? (p) => ctx.waitUntil(p) : undefined);
+
+  if (decision.storeError) {
+    console.warn(`⚠️ Rate limit KV error (fail-closed, request BLOCKED): ${decision.storeError}`);
+    log('warn', 'Rate limit KV failed, blocking request (fail-closed)', requestId, { error: decision.storeError, ip, endpoint });
+    return new Response(JSON.stringify({
+      error: 'Service temporarily unavailable',
+      retry_after: 30
+    }), {
+      status: 503,
+      headers: { 'Content-Type': 'application/json', 'Retry-After': '30' }
+    });
+  }
 
-    await env.SARA_CACHE.put(key, String(count + 1), { expirationTtl: windowSeconds });
-  } catch (e) {
-    if (failClosed) {
-      console.warn(`⚠️ Rate limit KV error (fail-closed, request BLOCKED): ${String(e)}`);
-      log('warn', 'Rate limit KV failed, blocking request (fail-closed)', requestId, { error: String(e), ip, endpoint });
-      return new Response(JSON.stringify({
-        error: 'Service temporarily unavailable',
-        retry_after: 30
-      }), {
-        status: 503,
-        headers: { 'Content-Type': 'application/json', 'Retry-After': '30' }
-      });
-    }
-    console.warn(`⚠️ Rate limit KV error (fail-open, request allowed): ${String(e)}`);
-    log('warn', 'Rate limit KV failed, allowing request (fail-open)', requestId, { error: String(e), ip, endpoint });
+  if (!decision.allowed) {
+    log('warn', `Rate limit exceeded for IP: ${ip}`, requestId, { ip, count: decision.count, limit, endpoint });
+    return new Response(JSON.stringify({
+      error: 'Too many requests',
+      retry_after: windowSeconds
+    }), {
+      status: 429,
+      headers: {
+        'Content-Type': 'application/json',
+        'Retry-After': String(windowSeconds),
+        'X-RateLimit-Limit': String(limit),
+        'X-RateLimit-Remaining': '0',
+      }
+    });
   }
 
   return null;
@@ -146,6 +153,15 @@ export async function checkRateLimit(request: Request, env: Env, requestId: stri
 // AUTH
 // ═══════════════════════════════════════════════════════════════════════════
 
+/** true si el request trae API_SECRET (header Bearer o ?api_key=) */
+export function hasValidApiKey(request: Request, env: Env): boolean {
+  if (!env.API_SECRET) return false;
+  const authHeader = request.headers.get('Authorization');
+  const apiKey = authHeader?.replace('Bearer ', '');
+  const queryKey = new URL(request.url).searchParams.get('api_key');
+  return apiKey === env.API_SECRET || queryKey === env.API_SECRET;
+}
+
 export function checkApiAuth(request: Request, env: Env): Response | null {
   if (!env.API_SECRET) {
     console.error('🚨 API_SECRET no configurado - bloqueando endpoints protegidos');
@@ -155,12 +171,7 @@ export function checkApiAuth(request: Request, env: Env): Response | null {
     }), 500);
   }
 
-  const authHeader = request.headers.get('Authorization');
-  const apiKey = authHeader?.replace('Bearer ', '');
-  const url = new URL(request.url);
-  const queryKey = url.searchParams.get('api_key');
-
-  if (apiKey === env.API_SECRET || queryKey === env.API_SECRET) {
+  if (hasValidApiKey(request, env)) {
     return null; // Autorizado
   }
 
@@ -0,0 +1,188 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// RATE LIMITER — Ventana deslizante en memoria del isolate + sync con KV
+// Cada clave (IP[:tenant]:endpoint) lleva su conteo en memoria: ventana
+// actual + ventana anterior ponderada por el tiempo restante. Mientras el
+// estimado queda lejos del límite la decisión es local (cero I/O). Cada
+// `headroom` requests (una fracción del límite) el delta se suma en KV en
+// background, y eso trae de vuelta lo que contaron los otros isolates.
+// Cerca del límite, o en rutas fail-closed sin sync válido, se sincroniza
+// antes de decidir.
+// ═══════════════════════════════════════════════════════════════════════════
+
+export const RATE_LIMIT_WINDOW_MS = 60_000;
+// Fracción del límite que puede acumularse sin reconciliar con KV
+export const RATE_LIMIT_SYNC_FRACTION = 0.1;
+export const RATE_LIMIT_MAX_KEYS = 5000;
+
+export interface RateLimitDecision {
+  allowed: boolean;
+  count: number;
+  limit: number;
+  remaining: number;
+  storeError?: string; // KV falló en un sync obligatorio
+}
+
+interface KeyState {
+  window: number;       // índice de ventana (ms / windowMs)
+  shared: number;       // total en KV tras el último sync (todos los isolates)
+  unsynced: number;     // requests de este isolate aún no sumadas en KV
+  inFlight: number;     // delta que un sync en curso está escribiendo
+  previous: number;     // total de la ventana anterior
+  synced: boolean;      // hubo sync exitoso en esta ventana
+  syncFailed: boolean;
+  syncing: Promise<void> | null;
+}
+
+export class HybridRateLimiter {
+  private keys = new Map<string, KeyState>();
+  private stats = { local: 0, synced: 0, background: 0, blocked: 0, storeErrors: 0 };
+
+  constructor(
+    private windowMs: number = RATE_LIMIT_WINDOW_MS,
+    private syncFraction: number = RATE_LIMIT_SYNC_FRACTION,
+    private maxKeys: number = RATE_LIMIT_MAX_KEYS
+  ) {}
+
+  async check(
+    kv: KVNamespace,
+    key: string,
+    limit: number,
+    failClosed: boolean,
+    waitUntil?: (p: Promise<any>) => void,
+    now: number = Date.now()
+  ): Promise<RateLimitDecision> {
+    const state = this.getState(kv, key, now, waitUntil);
+    const headroom = Math.max(1, Math.ceil(limit * this.syncFraction));
+
+    let estimate = this.estimate(state, now);
+    if (estimate >= limit) {
+      // Los conteos solo crecen dentro de la ventana: bloquear no requiere I/O
+      this.stats.blocked++;
+      return { allowed: false, count: Math.floor(estimate), limit, remaining: 0 };
+    }
+
+    const nearLimit = estimate + 1 > limit - headroom;
+    if (nearLimit || (failClosed && (!state.synced || state.syncFailed))) {
+      try {
+        await this.sync(kv, key, state);
+        this.stats.synced++;
+      } catch (e) {
+        this.stats.storeErrors++;
+        if (failClosed) {
+          return { allowed: false, count: Math.floor(estimate), limit, remaining: 0, storeError: String(e) };
+        }
+      }
+      estimate = this.estimate(state, now);
+      if (estimate >= limit) {
+        this.stats.blocked++;
+        return { allowed: false, count: Math.floor(estimate), limit, remaining: 0 };
+      }
+    } else {
+      this.stats.local++;
+    }
+
+    state.unsynced++;
+    if (state.unsynced >= headroom && !state.syncing) {
+      this.stats.background++;
+      const p = this.sync(kv, key, state).catch(() => { this.stats.storeErrors++; });
+      if (waitUntil) waitUntil(p);
+    }
+
+    const count = Math.floor(estimate) + 1;
+    return { allowed: true, count, limit, remaining: Math.max(0, limit - count) };
+  }
+
+  getStats(): { keys: number; local: number; synced: number; background: number; blocked: number; storeErrors: number } {
+    return { keys: this.keys.size, ...this.stats };
+  }
+
+  clear(): void {
+    this.keys.clear();
+    this.stats = { local: 0, synced: 0, background: 0, blocked: 0, storeErrors: 0 };
+  }
+
+  private estimate(state: KeyState, now: number): number {
+    const elapsed = (now % this.windowMs) / this.windowMs;
+    return state.previous * (1 - elapsed) + state.shared + state.inFlight + state.unsynced;
+  }
+
+  private getState(kv: KVNamespace, key: string, now: number, waitUntil?: (p: Promise<any>) => void): KeyState {
+    const window = Math.floor(now / this.windowMs);
+    let state = this.keys.get(key);
+
+    if (state) {
+      // LRU: re-insertar al final
+      this.keys.delete(key);
+      if (state.window !== window) {
+        // Lo no sincronizado de la ventana vieja se suma a su clave en KV
+        if (state.unsynced > 0 && waitUntil) {
+          waitUntil(this.addToStore(kv, key, state.window, state.unsynced).catch(() => {}));
+        }
+        const total = state.shared + state.inFlight + state.unsynced;
+        state = {
+          window,
+          shared: 0,
+          unsynced: 0,
+          inFlight: 0,
+          previous: state.window === window - 1 ? total : 0,
+          synced: false,
+          syncFailed: false,
+          syncing: null,
+        };
+      }
+    } else {
+      state = { window, shared: 0, unsynced: 0, inFlight: 0, previous: 0, synced: false, syncFailed: false, syncing: null };
+    }
+
+    this.keys.set(key, state);
+    while (this.keys.size > this.maxKeys) {
+      const oldest = this.keys.keys().next().value;
+      if (oldest === undefined) break;
+      this.keys.delete(oldest);
+    }
+    return state;
+  }
+
+  /** Suma el delta pendiente en KV y trae el total compartido (un sync en vuelo por clave) */
+  private sync(kv: KVNamespace, key: string, state: KeyState): Promise<void> {
+    if (state.syncing) return state.syncing;
+
+    const window = state.window;
+    const delta = state.unsynced;
+    state.unsynced = 0;
+    state.inFlight = delta;
+
+    state.syncing = (async () => {
+      try {
+        const total = await this.addToStore(kv, key, window, delta);
+        if (state.window === window) {
+          state.inFlight = 0;
+          state.shared = total;
+          state.synced = true;
+          state.syncFailed = false;
+        }
+      } catch (e) {
+        if (state.window === window) {
+          state.inFlight = 0;
+          state.unsynced += delta;
+          state.syncFailed = true;
+        }
+        throw e;
+      } finally {
+        state.syncing = null;
+      }
+    })();
+    return state.syncing;
+  }
+
+  private async addToStore(kv: KVNamespace, key: string, window: number, delta: number): Promise<number> {
+    const storeKey = `ratelimit:${key}:${window}`;
+    const current = await kv.get(storeKey);
+    const total = (current ? parseInt(current, 10) || 0 : 0) + delta;
+    if (delta > 0) {
+      // 2 ventanas: la siguiente la usa como "previous" (KV exige TTL >= 60s)
+      await kv.put(storeKey, String(total), { expirationTtl: Math.max(60, Math.ceil((this.windowMs * 2) / 1000)) });
+    }
+    return total;
+  }
+}
@@ -0,0 +1,151 @@
+// ═══════════════════════════════════════════════════════════════════════════
+// ROUTER — Tabla de rutas compilada una vez por isolate
+// Cada ruta declara método, path (exacto, o prefijo con '*' final), nivel de
+// auth, clase de rate-limit y handler. compileRoutes() arma un trie por
+// carácter: match() recorre el pathname una sola vez (O(largo del path)) y
+// devuelve las rutas candidatas en orden de declaración. Los módulos que
+// siguen teniendo su propia cadena interna (test.ts, api-bi.ts...) se montan
+// por prefijo y solo se invocan si el path puede ser suyo.
+// ═══════════════════════════════════════════════════════════════════════════
+
+/**
+ * - public:  sin auth (webhooks, health)
+ * - api_key: exige API_SECRET (checkApiAuth) antes del handler
+ * - path:    decide requiresAuth(pathname) — módulos con rutas mixtas
+ */
+export type RouteAuth = 'public' | 'api_key' | 'path';
+
+export type RateLimitClass = 'default' | 'ai' | 'load_test' | 'cron' | 'messaging';
+
+/** req/min por IP y si se bloquea cuando KV falla */
+export const RATE_LIMIT_CLASSES: Record<RateLimitClass, { max: number; failClosed: boolean }> = {
+  default: { max: 100, failClosed: false },
+  ai: { max: 10, failClosed: true },         // llamada a Claude
+  load_test: { max: 5, failClosed: true },   // simula N leads concurrentes
+  cron: { max: 10, failClosed: true },       // /run-* disparan CRONs
+  messaging: { max: 20, failClosed: true },  // envía WhatsApp real
+};
+
+export type RouteHandler<C> = (context: C) => Promise<Response | null>;
+
+export interface RouteDef<C> {
+  name: string;
+  method?: string;            // GET/POST/...; omitido = cualquiera
+  path: string;               // '/webhook/meta' exacto, '/api/leads*' prefijo
+  auth: RouteAuth;
+  rateLimit: RateLimitClass;
+  handler: RouteHandler<C>;
+}
+
+interface TrieNode<C> {
+  children: Map<string, TrieNode<C>>;
+  exact: { index: number; route: RouteDef<C> }[];
+  prefix: { index: number; route: RouteDef<C> }[];
+}
+
+export interface RouteTiming {
+  count: number;
+  totalMs: number;
+  maxMs: number;
+  avgMs: number;
+}
+
+// Tiempos por ruta del isolate (se leen en /api/observability)
+const routeTimings: Map<string, { count: number; totalMs: number; maxMs: number }> = new Map();
+
+export function recordRouteTiming(name: string, ms: number): void {
+  const t = routeTimings.get(name) || { count: 0, totalMs: 0, maxMs: 0 };
+  t.count++;
+  t.totalMs += ms;
+  if (ms > t.maxMs) t.maxMs = ms;
+  routeTimings.set(name, t);
+}
+
+export function getRouteTimings(): Record<string, RouteTiming> {
+  const out: Record<string, RouteTiming> = {};
+  for (const [name, t] of routeTimings) {
+    out[name] = { ...t, avgMs: t.count > 0 ? Math.round(t.totalMs / t.count) : 0 };
+  }
+  return out;
+}
+
+export function resetRouteTimings(): void {
+  routeTimings.clear();
+}
+
+export class CompiledRouter<C> {
+  private root: TrieNode<C> = { children: new Map(), exact: [], prefix: [] };
+
+  constructor(private routes: RouteDef<C>[]) {
+    routes.forEach((route, index) => {
+      const isPrefix = route.path.endsWith('*');
+      const literal = isPrefix ? route.path.slice(0, -1) : route.path;
+      let node = this.root;
+      for (const ch of literal) {
+        let next = node.children.get(ch);
+        if (!next) {
+          next = { children: new Map(), exact: [], prefix: [] };
+          node.children.set(ch, next);
+        }
+        node = next;
+      }
+      (isPrefix ? node.prefix : node.exact).push({ index, route });
+    });
+  }
+
+  /**
+   * Rutas candidatas para el pathname, en orden de declaración. Incluye las
+   * de cualquier método: la política (rate limit/auth) se decide por path y
+   * dispatch() filtra por método.
+   */
+  match(pathname: string): RouteDef<C>[] {
+    const found: { index: number; route: RouteDef<C> }[] = [];
+    let node: TrieNode<C> | undefined = this.root;
+    found.push(...node.prefix);
+    for (const ch of pathname) {
+      node = node.children.get(ch);
+      if (!node) break;
+      found.push(...node.prefix);
+    }
+    if (node) found.push(...node.exact);
+
+    return found.sort((a, b) => a.index - b.index).map(f => f.route);
+  }
+
+  /**
+   * Ejecuta las candidatas hasta que una responda. Un mismo handler montado
+   * en varios prefijos se invoca una sola vez. null = ninguna ruta respondió.
+   */
+  async dispatch(candidates: RouteDef<C>[], method: string, context: C): Promise<Response | null> {
+    const tried = new Set<RouteHandler<C>>();
+    for (const route of candidates) {
+      if (route.method && route.method !== method) continue;
+      if (tried.has(route.handler)) continue;
+      tried.add(route.handler);
+      const start = Date.now();
+      const response = await route.handler(context);
+      recordRouteTiming(route.name, Date.now() - start);
+      if (response) return response;
+    }
+    return null;
+  }
+}
+
+/**
+ * Política del request según sus candidatas: la clase de rate-limit más
+ * estricta y el nivel de auth más exigente. Sin candidatas → default/path.
+ */
+export function routePolicy<C>(candidates: RouteDef<C>[]): { rateLimit: RateLimitClass; auth: RouteAuth } {
+  let rateLimit: RateLimitClass = 'default';
+  let auth: RouteAuth = candidates.length > 0 ? 'public' : 'path';
+  for (const route of candidates) {
+    if (RATE_LIMIT_CLASSES[route.rateLimit].max < RATE_LIMIT_CLASSES[rateLimit].max) rateLimit = route.rateLimit;
+    if (route.auth === 'api_key') auth = 'api_key';
+    else if (route.auth === 'path' && auth === 'public') auth = 'path';
+  }
+  return { rateLimit, auth };
+}
+
+export function compileRoutes<C>(routes: RouteDef<C>[]): CompiledRouter<C> {
+  return new CompiledRouter(routes);
+}
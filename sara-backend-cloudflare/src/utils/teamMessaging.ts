@@ -11,6 +11,7 @@ import { MetaWhatsAppService } from '../services/meta-whatsapp';
 import { createRetellService, RetellService } from '../services/retellService';
 import { createTTSService, TTSService } from '../services/ttsService';
 import { safeJsonParse } from './safeHelpers';
+import { getEntityCache } from '../services/entityCache';
 import { enviarAlertaSistema } from '../crons/healthCheck';
 
 export interface EnviarMensajeTeamResult {
@@ -179,6 +180,7 @@ export async function enviarMensajeTeamMember(
           if (wamidError) {
             console.error(`   ⚠️ Error guardando wamid en notes:`, wamidError);
           } else {
+            getEntityCache(supabase).patchTeamMember(teamMember.id, { notes: notasActuales });
             console.log(`   📝 Wamid ${wamid.substring(0, 15)}... guardado en notes (${notasActuales.last_team_message_wamids.length} total)`);
           }
         }
@@ -382,6 +384,7 @@ async function guardarMensajePending(
     // Propagar error para que el caller sepa que el pending NO se guardó
     throw new Error(`Failed to save pending ${pendingKey}: ${pendingError.message || pendingError.code}`);
   } else {
+    getEntityCache(supabase).patchTeamMember(teamMemberId, { notes: nuevasNotas });
     console.log(`   💾 Mensaje guardado como ${pendingKey} (expira en ${expirationHours}h)${wamid ? `, wamid: ${wamid.substring(0, 15)}...` : ''}`);
   }
 }
@@ -511,6 +514,7 @@ export async function llamarTeamMemberConRetell(
         .from('team_members')
         .update({ notes: nuevasNotas })
         .eq('id', teamMember.id);
+      getEntityCache(supabase).patchTeamMember(teamMember.id, { notes: nuevasNotas });
 
       return { success: true, callId: result.callId };
     } else {